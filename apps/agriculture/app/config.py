@@ -43,6 +43,11 @@ class Settings:
     PAYMENTS_INTERNAL_SECRET: str = os.getenv("PAYMENTS_INTERNAL_SECRET", "")
     FEE_WALLET_PHONE: str = os.getenv("FEE_WALLET_PHONE", "+963000000000")
     PAYMENTS_WEBHOOK_SECRET: str = os.getenv("PAYMENTS_WEBHOOK_SECRET", "")
+    # Inbound Payments webhooks: PAYMENTS_WEBHOOK_SECRET may list "current,previous" during rotation;
+    # failed handlers are retried every WEBHOOK_RETRY_SWEEP_SECS and dead-lettered after WEBHOOK_MAX_ATTEMPTS
+    WEBHOOK_TOLERANCE_SECS: int = int(os.getenv("WEBHOOK_TOLERANCE_SECS", "300"))
+    WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+    WEBHOOK_RETRY_SWEEP_SECS: int = int(os.getenv("WEBHOOK_RETRY_SWEEP_SECS", "30"))
 
     @property
     def jwt_expires_delta(self) -> timedelta:
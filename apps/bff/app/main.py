@@ -17,6 +17,8 @@ try:
 except Exception:  # pragma: no cover
     redis = None
 
+from superapp_shared.cache import BoundedTTLCache, register_prometheus_collector as _register_cache_metrics
+
 try:  # Optional JWT verification (RS256 via JWKS)
     from superapp_shared.jwks_verify import decode_with_jwks as _jwks_decode
 except Exception:  # pragma: no cover
@@ -185,6 +187,9 @@ PUSH_REG: Dict[str, list[Dict[str, Any]]] = {}
 TOPICS: Dict[str, set] = {}
 USER_TOPICS: Dict[str, set] = {}
 REDIS: Optional["redis.Redis"] = None
+# In-memory token buckets (fallback when Redis is down). Idle buckets refill to
+# capacity within a minute, so dropping them after 120s is lossless.
+_RL_BUCKETS = BoundedTTLCache("bff_rate_limit", maxsize=int(os.getenv("BFF_RL_MAX_CLIENTS", "50000")), ttl=120.0)
 
 
 @app.middleware("http")
@@ -216,9 +221,7 @@ async def metrics_middleware(request: Request, call_next):
             except Exception:
                 limited = False
         else:
-            if not hasattr(app.state, "_rl"):
-                app.state._rl = {}
-            b = app.state._rl.get(ip)
+            b = _RL_BUCKETS.get(ip)
             cap = 60
             rate = 1.0
             if not b:
@@ -231,7 +234,7 @@ async def metrics_middleware(request: Request, call_next):
                 limited = True
             else:
                 b["tokens"] -= need
-            app.state._rl[ip] = b
+            _RL_BUCKETS.set(ip, b)
     if limited:
         try:
             getattr(app.state, "REQ_COUNTER").labels(request.method, _metrics_path_label(request), "429").inc()
@@ -399,6 +402,7 @@ async def on_startup():
         except Exception:
             # ignore duplicate registration in edge cases
             pass
+        _register_cache_metrics()
     if REDIS_URL and redis is not None:
         try:
             REDIS = redis.from_url(REDIS_URL, decode_responses=True)
@@ -867,7 +871,7 @@ def _auth_headers(authz: str | None) -> Dict[str, str]:
     return h
 
 
-_ME_CACHE: Dict[str, tuple[float, Dict[str, Any]]] = {}
+_ME_CACHE = BoundedTTLCache("bff_me", maxsize=int(os.getenv("BFF_ME_CACHE_MAX_ENTRIES", "10000")), ttl=2.0)
 
 
 def _gen_request_id() -> str:
@@ -913,10 +917,9 @@ async def me(request: Request, authorization: str | None = Header(default=None))
 
     # Cache key per user
     sub = _decode_sub_from_bearer(headers.get("Authorization", "")) or "anon"
-    now = time.time()
     cached = _ME_CACHE.get(sub)
-    if cached and now - cached[0] < 2.0:
-        return Response(content=pyjson.dumps(cached[1]), media_type="application/json", headers={"Cache-Control": "private, max-age=2"})
+    if cached is not None:
+        return Response(content=pyjson.dumps(cached), media_type="application/json", headers={"Cache-Control": "private, max-age=2"})
 
     async with httpx.AsyncClient() as client:
         wallet = await _fetch_json(client, "GET", f"{PAYMENTS_BASE_URL}/wallet", headers=headers, request=request)
@@ -973,7 +976,7 @@ async def me(request: Request, authorization: str | None = Header(default=None))
             "chat": chat_sum,
         },
     }
-    _ME_CACHE[sub] = (now, out)
+    _ME_CACHE.set(sub, out)
     return Response(content=pyjson.dumps(out), media_type="application/json", headers={"Cache-Control": "private, max-age=2"})
 
 
@@ -24,6 +24,8 @@ from .middleware_request_id import RequestIDMiddleware
 from .middleware_rate_limit import SlidingWindowLimiter
 from .middleware_rate_limit_redis import RedisRateLimiter
 from .utils.security import SecurityHeadersMiddleware
+from superapp_shared.idempotency import IdempotencyMiddleware, idempotency_store_from_env, register_prometheus_collector as register_idempotency_metrics
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, store_from_env
 from fastapi.openapi.utils import get_openapi
 from fastapi.responses import PlainTextResponse
 import json
@@ -34,6 +36,24 @@ except Exception:
     sentry_sdk = None
 
 
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler retrying payment handoffs for bookings."""
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="bus", **kw)
+
+    def _payment_sagas(ctx):
+        from .payment_saga import saga
+
+        return saga.process_due()
+
+    # One partition: claims skip rows another replica holds, so the whole backlog is shared safely
+    secs = settings.PAYMENT_SAGA_SWEEP_SECS
+    sched.add_job(
+        "bus_payment_saga", _payment_sagas, IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    return sched
+
+
 def create_app() -> FastAPI:
     # Optional Sentry init (no-op if DSN missing)
     dsn = os.getenv("SENTRY_DSN", "").strip()
@@ -63,6 +83,13 @@ def create_app() -> FastAPI:
 
     # Request ID + JSON logs + security + gzip
     app.add_middleware(RequestIDMiddleware)
+    # Idempotency-Key on bookings (inside gzip so stored bodies are uncompressed)
+    app.add_middleware(
+        IdempotencyMiddleware,
+        store=idempotency_store_from_env(engine, settings.REDIS_URL, prefix="idem:bus"),
+        service="bus",
+        paths=["/bookings"],
+    )
     app.add_middleware(SecurityHeadersMiddleware)
     app.add_middleware(GZipMiddleware, minimum_size=500)
     # Trusted hosts + forwarded headers
@@ -138,6 +165,9 @@ def create_app() -> FastAPI:
             pass
         return response
 
+    # idempotency_requests_total{outcome=executed|replayed|coalesced|conflicts|...}
+    register_idempotency_metrics()
+
     @app.get("/metrics")
     def metrics():
         return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -147,7 +177,10 @@ def create_app() -> FastAPI:
     app.include_router(bookings_router.router)
     app.include_router(promos_router.router)
     app.include_router(operators_router.router)
-    
+
+    if settings.PAYMENT_SAGA_SWEEP_SECS > 0:
+        install_scheduler(app, build_scheduler())
+
     # OpenAPI customization: provide YAML and mark public routes unauthenticated
     def custom_openapi():
         if app.openapi_schema:
@@ -0,0 +1,49 @@
+"""Payment handoff for seat bookings (see ``superapp_shared.payment_saga``).
+
+The saga row is written with the seat assignment, sent right after the
+commit and retried by the ``bus_payment_saga`` job. If Payments never takes
+the request, the seats go back on sale and the reserved booking is canceled.
+"""
+from __future__ import annotations
+
+import uuid
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from superapp_shared.payment_saga import PaymentSaga, SagaRecord, register_prometheus_collector
+
+from .config import settings
+from .database import SessionLocal
+from .models import Booking, Trip, TripSeat
+
+saga = PaymentSaga(
+    "bus",
+    SessionLocal,
+    base_url=lambda: settings.PAYMENTS_BASE_URL,
+    secret=lambda: settings.PAYMENTS_INTERNAL_SECRET,
+    timeout_secs=3.0,
+    max_attempts=settings.PAYMENT_SAGA_MAX_ATTEMPTS,
+)
+register_prometheus_collector()
+
+
+@saga.on_requested("booking")
+def _requested(db: Session, rec: SagaRecord):
+    linked = db.execute(
+        update(Booking).where(Booking.id == uuid.UUID(rec.ref_id), Booking.status != "canceled")
+        .values(payment_request_id=rec.payment_request_id).execution_options(synchronize_session=False)
+    ).rowcount
+    # Canceled while the request was in flight: have the saga withdraw it
+    return bool(linked)
+
+
+@saga.on_failed("booking")
+def _release(db: Session, rec: SagaRecord) -> None:
+    b = db.execute(select(Booking).where(Booking.id == uuid.UUID(rec.ref_id)).with_for_update()).scalars().first()
+    # Confirmed or canceled meanwhile: leave it alone
+    if b is None or b.status != "reserved":
+        return
+    db.execute(update(Trip).where(Trip.id == b.trip_id).values(seats_available=Trip.seats_available + b.seats_count))
+    db.execute(update(TripSeat).where(TripSeat.booking_id == b.id).values(booking_id=None))
+    b.status = "canceled"
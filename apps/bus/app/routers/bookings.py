@@ -1,5 +1,5 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 import httpx
 
@@ -9,6 +9,7 @@ from sqlalchemy import func, select
 from ..models import User, Trip, Booking, Operator, TripSeat, PromoCode, PromoRedemption, TripRating
 from ..schemas import CreateBookingIn, BookingOut, BookingsListOut, CancelIn, TicketOut, RateBookingIn
 from superapp_shared.internal_hmac import sign_internal_request_headers
+from ..payment_saga import saga as payment_saga
 
 
 router = APIRouter(prefix="/bookings", tags=["bookings"])
@@ -36,7 +37,7 @@ def _to_booking_out(db: Session, b: Booking) -> BookingOut:
 
 
 @router.post("", response_model=BookingOut)
-def create_booking(payload: CreateBookingIn, request: Request, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_booking(payload: CreateBookingIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     trip = db.get(Trip, payload.trip_id)
     if trip is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trip not found")
@@ -107,37 +108,26 @@ def create_booking(payload: CreateBookingIn, request: Request, user: User = Depe
             db.add(PromoRedemption(promo_code_id=pc.id, booking_id=booking.id, user_id=user.id))
 
     # Frontend pays directly via Payments /wallet/transfer using merchant phone; we expose it below.
-    db.flush()
+    # Determine merchant wallet phone: operator override or platform default
+    op = db.get(Operator, trip.operator_id) if trip else None
+    merchant_phone = op.merchant_phone if op and op.merchant_phone else settings.FEE_WALLET_PHONE
+    saga_id = None
+    if total > 0 and payment_saga.enabled:
+        # Payments request for this booking, recorded with the seats so an outage retries it instead of losing it
+        saga_id = payment_saga.begin(
+            db, "booking", booking.id, from_phone=merchant_phone, to_phone=user.phone, amount_cents=int(total),
+            metadata={"booking_id": str(booking.id), "service": "bus"},
+        )
+    db.commit()
+    if saga_id:
+        payment_saga.dispatch(saga_id)
+        db.refresh(booking)
 
     out = _to_booking_out(db, booking)
     seats = db.query(TripSeat).filter(TripSeat.booking_id == booking.id).order_by(TripSeat.seat_number.asc()).all()
     out.seat_numbers = [int(r.seat_number) for r in seats]
-    # Determine merchant wallet phone: operator override or platform default
-    op = db.get(Operator, trip.operator_id) if trip else None
-    merchant_phone = op.merchant_phone if op and op.merchant_phone else settings.FEE_WALLET_PHONE
     out.merchant_phone = merchant_phone
-
-    # Create Payments internal request for this booking (best-effort)
-    try:
-        payload_req = {
-            "from_phone": merchant_phone,
-            "to_phone": user.phone,
-            "amount_cents": int(total),
-            "metadata": {"booking_id": str(booking.id), "service": "bus"},
-        }
-        url = f"{settings.PAYMENTS_BASE_URL}/internal/requests"
-        # Sign HMAC headers, include idempotency key
-        headers = sign_internal_request_headers(payload_req, settings.PAYMENTS_INTERNAL_SECRET, None, request.headers.get("X-Request-ID", None))
-        headers["X-Idempotency-Key"] = f"bus-booking-{booking.id}"
-        with httpx.Client(timeout=3.0) as client:
-            r = client.post(url, json=payload_req, headers=headers)
-            if r.status_code == 200 and (r.json() or {}).get("id"):
-                booking.payment_request_id = r.json()["id"]
-                db.flush()
-                out.payment_request_id = booking.payment_request_id
-    except Exception:
-        # Ignore failures; client can still pay via merchant phone directly
-        pass
+    out.payment_request_id = booking.payment_request_id
     return out
 
 
@@ -202,11 +192,26 @@ def cancel_booking(booking_id: str, payload: CancelIn | None = None, user: User
     rows = db.query(TripSeat).filter(TripSeat.booking_id == b.id).all()
     for r in rows:
         r.booking_id = None
+    # Not sent yet: never ask for it. Already recorded: withdraw it; still in flight: withdrawn once recorded
+    if not payment_saga.cancel(db, "booking", b.id):
+        payment_saga.void(db, "booking", b.id)
     b.status = "canceled"
     db.flush()
     return {"detail": "canceled"}
 
 
+@router.get("/{booking_id}/payment")
+def booking_payment(booking_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Where the payment handoff stands: pending (being retried), requested, compensated (seats released) or canceled."""
+    b = db.get(Booking, booking_id)
+    if b is None or b.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Booking not found")
+    rec = payment_saga.status(db, "booking", b.id)
+    if rec is not None:
+        return rec.to_dict()
+    return {"status": "requested" if b.payment_request_id else "none", "payment_request_id": b.payment_request_id, "amount_cents": b.total_price_cents, "attempts": 0, "next_attempt_at": None}
+
+
 @router.post("/{booking_id}/rate")
 def rate_booking(booking_id: str, payload: RateBookingIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     b = db.execute(select(Booking).where(Booking.id == booking_id).with_for_update()).scalars().first()
@@ -281,6 +286,9 @@ def confirm_booking(booking_id: str, user: User = Depends(get_current_user), db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Booking not found")
     if b.status == "confirmed":
         return {"detail": "confirmed"}
+    if b.status == "canceled":
+        # Includes bookings whose payment request never went through (seats already released)
+        raise HTTPException(status_code=400, detail="Booking canceled")
     # If a payment_request_id exists, verify status with Payments internal API
     if b.payment_request_id:
         try:
@@ -0,0 +1,137 @@
+import datetime as dt
+import json
+import os
+import random
+import uuid
+
+import httpx
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+os.environ.setdefault("DB_URL", os.getenv("DB_URL", "postgresql+psycopg2://postgres:postgres@pg:5432/postgres"))
+
+from app.config import settings  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import Booking, Operator, Trip, TripSeat  # noqa: E402
+from app.payment_saga import saga  # noqa: E402
+
+
+client = TestClient(app)
+
+
+class FlakyPayments:
+    """Local stand-in for Payments ``/internal/requests`` and ``/internal/requests/cancel``.
+
+    Keeps one request per idempotency key like the real service, and fails
+    ``fail_rate`` of the calls: connection refused, 502, or the work is done
+    but the answer is lost. ``during_create`` runs before a request is
+    created, as if the booking changed while the call was in flight.
+    """
+
+    def __init__(self, seed: int, fail_rate: float = 0.5):
+        self.rnd = random.Random(seed)
+        self.fail_rate = fail_rate
+        self.created: dict[str, str] = {}
+        self.canceled: set[str] = set()
+        self.during_create = None
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        roll = self.rnd.random()
+        if roll < self.fail_rate / 3:
+            raise httpx.ConnectError("connection refused", request=request)
+        if roll < self.fail_rate * 2 / 3:
+            return httpx.Response(502)
+        if request.url.path == "/internal/requests/cancel":
+            pr_id = self.created.get(json.loads(request.content)["idempotency_key"])
+            if pr_id is not None:
+                self.canceled.add(pr_id)
+            answer = httpx.Response(200, json={"id": pr_id, "status": "canceled"}) if pr_id else httpx.Response(404)
+        else:
+            if self.during_create is not None:
+                self.during_create()
+            pr_id = self.created.setdefault(request.headers["X-Idempotency-Key"], f"PR_{uuid.uuid4().hex[:12]}")
+            answer = httpx.Response(200, json={"id": pr_id})
+        if roll < self.fail_rate:
+            raise httpx.ReadTimeout("answer lost", request=request)
+        return answer
+
+
+def _auth():
+    phone = f"+9639{uuid.uuid4().int % 10**8:08d}"
+    client.post("/auth/request_otp", json={"phone": phone})
+    r = client.post("/auth/verify_otp", json={"phone": phone, "otp": "123456", "name": "Rider"})
+    assert r.status_code == 200, r.text
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _trip(seats=40):
+    with SessionLocal() as db:
+        op = Operator(name=f"Op-{uuid.uuid4().hex[:8]}")
+        db.add(op)
+        db.flush()
+        depart = dt.datetime.utcnow() + dt.timedelta(days=3)
+        t = Trip(operator_id=op.id, origin="Damascus", destination="Homs", depart_at=depart, price_cents=1200, seats_total=seats, seats_available=seats)
+        db.add(t)
+        db.commit()
+        return str(t.id)
+
+
+def _stub(monkeypatch, stub):
+    monkeypatch.setattr(settings, "PAYMENTS_BASE_URL", "http://payments.stub")
+    monkeypatch.setattr(settings, "PAYMENTS_INTERNAL_SECRET", "sek")
+    monkeypatch.setattr(saga, "transport", httpx.MockTransport(stub))
+    monkeypatch.setattr(saga, "retry_base_secs", 0)
+    monkeypatch.setattr(saga, "max_attempts", 6)
+    return stub
+
+
+def test_canceled_bookings_withdraw_their_payment_requests(monkeypatch):
+    stub = _stub(monkeypatch, FlakyPayments(seed=5, fail_rate=0.6))
+    h, trip_id = _auth(), _trip()
+    booked = [client.post("/bookings", headers=h, json={"trip_id": trip_id, "seats_count": 1}).json() for _ in range(10)]
+    with SessionLocal() as db:
+        before = {b["id"]: saga.status(db, "booking", b["id"]).status for b in booked}
+    for b in booked:
+        assert client.post(f"/bookings/{b['id']}/cancel", headers=h).status_code == 200
+    for _ in range(20):
+        saga.process_due()
+    outcomes = []
+    with SessionLocal() as db:
+        for b in booked:
+            rec = saga.status(db, "booking", b["id"])
+            outcomes.append((before[b["id"]], rec.status))
+            assert db.get(Booking, uuid.UUID(b["id"])).status == "canceled"
+            if rec.status == "voided":
+                # Recorded before the cancel, or created by an attempt whose answer was lost: withdrawn, retried through the outage
+                assert rec.payment_request_id in stub.canceled and rec.last_error is None
+            else:
+                # Never reached Payments
+                assert rec.status == "canceled" and saga.idempotency_key("booking", b["id"]) not in stub.created
+        assert db.get(Trip, uuid.UUID(trip_id)).seats_available == 40
+    # Withdrawn whether the request was recorded or only its lost answer could have created one
+    assert {("requested", "voided"), ("pending", "voided"), ("pending", "canceled")} <= set(outcomes), outcomes
+    assert set(stub.created.values()) <= stub.canceled
+
+
+def test_booking_canceled_while_its_request_is_in_flight_is_withdrawn(monkeypatch):
+    stub = _stub(monkeypatch, FlakyPayments(seed=1, fail_rate=0))
+    h, trip_id = _auth(), _trip()
+
+    def cancel_meanwhile():
+        # The rider cancels while Payments is still answering the request
+        stub.during_create = None
+        with SessionLocal() as db:
+            b = db.execute(select(Booking).where(Booking.trip_id == uuid.UUID(trip_id))).scalar_one()
+        assert client.post(f"/bookings/{b.id}/cancel", headers=h).status_code == 200
+
+    stub.during_create = cancel_meanwhile
+    b = client.post("/bookings", headers=h, json={"trip_id": trip_id, "seats_count": 2}).json()
+    assert b["payment_request_id"] is None
+    with SessionLocal() as db:
+        rec = saga.status(db, "booking", b["id"])
+        row = db.get(Booking, uuid.UUID(b["id"]))
+        assert rec.status == "voided" and rec.payment_request_id in stub.canceled
+        assert row.status == "canceled" and row.payment_request_id is None
+        assert not db.execute(select(TripSeat).where(TripSeat.booking_id == row.id)).scalars().all()
+    assert client.get(f"/bookings/{b['id']}/payment", headers=h).json()["status"] == "voided"
@@ -0,0 +1,269 @@
+"""Rental inventory: per-day occupancy, holds and availability reads.
+
+A booking takes one ``carrental_vehicle_days`` row per rental day, from
+``start_date`` up to (not including) ``end_date``, the return day. The
+table's primary key ``(vehicle_id, day)`` is the overlap exclusion: a
+booking inserts all of its days in one statement under a savepoint, and a
+concurrent booking for any of the same days fails on the key instead of
+passing a separate check. Back-to-back rentals (return and pickup on the
+same day) do not collide.
+
+Unpaid (``requested``) bookings hold their days until ``hold_expires_at``
+(``CARRENTAL_HOLD_MINUTES``); the expiry is copied onto the day rows so reads
+can skip lapsed holds without a join. A lapsed hold is released on demand by
+the next booking that needs the day, and in bulk by ``expire_holds`` (the
+``carrental_hold_expiry`` job). Confirmation (seller or payment webhook)
+clears the hold; confirming a lapsed booking re-takes its days if they are
+still free.
+"""
+from __future__ import annotations
+
+import datetime as dt
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, exists, insert, or_, select, true, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Booking, Vehicle, VehicleDay
+
+MAX_RANGE_DAYS = 366
+
+
+class Unavailable(Exception):
+    """Some day of the requested range is already taken."""
+
+
+def parse_range(start_date: str, end_date: str, max_days: int = MAX_RANGE_DAYS) -> Tuple[dt.date, dt.date]:
+    """ISO dates -> (start, end); ``ValueError`` unless start < end and the range is at most ``max_days``."""
+    try:
+        sd, ed = dt.date.fromisoformat(start_date), dt.date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid dates")
+    if ed <= sd:
+        raise ValueError("end_date must be after start_date")
+    if (ed - sd).days > max_days:
+        raise ValueError(f"range longer than {max_days} days")
+    return sd, ed
+
+
+def rental_days(start: dt.date, end: dt.date) -> List[dt.date]:
+    return [start + dt.timedelta(days=i) for i in range((end - start).days)]
+
+
+def _taken(now: dt.datetime):
+    """Day rows that still block: firm bookings and holds that have not lapsed."""
+    return or_(VehicleDay.hold_expires_at.is_(None), VehicleDay.hold_expires_at > now)
+
+
+# -- writes ----------------------------------------------------------------------
+
+
+def _release_lapsed(db: Session, vehicle_id, start: dt.date, end: dt.date, now: dt.datetime) -> int:
+    """Expire lapsed holds on these days of this vehicle, freeing them for the caller."""
+    lapsed = select(VehicleDay.booking_id).where(
+        VehicleDay.vehicle_id == vehicle_id, VehicleDay.day >= start, VehicleDay.day < end,
+        VehicleDay.hold_expires_at <= now,
+    )
+    ids = db.execute(
+        update(Booking)
+        .where(Booking.id.in_(lapsed), Booking.status == "requested", Booking.hold_expires_at <= now)
+        .values(status="expired")
+        .returning(Booking.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if ids:
+        db.execute(delete(VehicleDay).where(VehicleDay.booking_id.in_(ids)))
+    return len(ids)
+
+
+def _take_days(db: Session, b: Booking, start: dt.date, end: dt.date, hold_until: Optional[dt.datetime]) -> None:
+    """Insert the booking (if new) and its day rows under one savepoint; a taken day undoes both."""
+    sp = db.begin_nested()
+    try:
+        db.add(b)
+        db.flush()
+        db.execute(insert(VehicleDay), [
+            {"vehicle_id": b.vehicle_id, "day": d, "booking_id": b.id, "hold_expires_at": hold_until}
+            for d in rental_days(start, end)
+        ])
+        sp.commit()
+    except IntegrityError:
+        sp.rollback()
+        raise Unavailable()
+
+
+def reserve(db: Session, vehicle: Vehicle, user_id, start: dt.date, end: dt.date, *, hold_minutes: Optional[int] = None, now: Optional[dt.datetime] = None) -> Booking:
+    """Create a ``requested`` booking holding its days, or raise ``Unavailable``; the caller commits."""
+    now = now or dt.datetime.utcnow()
+    hold_minutes = settings.CARRENTAL_HOLD_MINUTES if hold_minutes is None else hold_minutes
+    hold_until = now + dt.timedelta(minutes=hold_minutes) if hold_minutes > 0 else None
+    days = (end - start).days
+    b = Booking(
+        user_id=user_id, vehicle_id=vehicle.id, start_date=start.isoformat(), end_date=end.isoformat(),
+        days=days, total_cents=days * int(vehicle.price_per_day_cents), status="requested", hold_expires_at=hold_until,
+    )
+    _release_lapsed(db, vehicle.id, start, end, now)
+    _take_days(db, b, start, end, hold_until)
+    return b
+
+
+def confirm(db: Session, b: Booking) -> None:
+    """Make the booking firm; a lapsed hold is re-taken if its days are still free (else ``Unavailable``).
+
+    The booking row is locked and re-read first, so a sweeper or ``_release_lapsed``
+    expiring it concurrently either waits for this commit or is seen here as expired.
+    A canceled booking raises ``Unavailable``; a confirmed one is left as is.
+    """
+    db.refresh(b, with_for_update=True)
+    if b.status == "confirmed":
+        return
+    if b.status not in ("requested", "expired"):
+        raise Unavailable()
+    sd, ed = dt.date.fromisoformat(b.start_date), dt.date.fromisoformat(b.end_date)
+    kept = 0
+    if b.status == "requested":
+        kept = db.execute(update(VehicleDay).where(VehicleDay.booking_id == b.id).values(hold_expires_at=None)).rowcount
+    if kept != len(rental_days(sd, ed)):
+        db.execute(delete(VehicleDay).where(VehicleDay.booking_id == b.id))
+        _release_lapsed(db, b.vehicle_id, sd, ed, dt.datetime.utcnow())
+        _take_days(db, b, sd, ed, None)
+    b.status = "confirmed"
+    b.hold_expires_at = None
+    db.flush()
+
+
+def release(db: Session, b: Booking, status: str = "canceled") -> None:
+    """Cancel (or expire) the booking and free its days."""
+    db.execute(delete(VehicleDay).where(VehicleDay.booking_id == b.id))
+    b.status = status
+    b.hold_expires_at = None
+    db.flush()
+
+
+def expire_holds(db: Session, now: Optional[dt.datetime] = None, batch: int = 500, where=None) -> int:
+    """Expire unpaid bookings whose hold lapsed and free their days; returns how many.
+
+    ``where`` narrows the bookings considered (the scheduler passes its partition clause).
+    """
+    now = now or dt.datetime.utcnow()
+    total = 0
+    while True:
+        due = (
+            select(Booking.id)
+            .where(Booking.status == "requested", Booking.hold_expires_at <= now, where if where is not None else true())
+            .limit(batch)
+            .with_for_update(skip_locked=True)
+        )
+        ids = db.execute(
+            update(Booking).where(Booking.id.in_(due.scalar_subquery())).values(status="expired")
+            .returning(Booking.id).execution_options(synchronize_session=False)
+        ).scalars().all()
+        if ids:
+            db.execute(delete(VehicleDay).where(VehicleDay.booking_id.in_(ids)))
+        db.commit()
+        total += len(ids)
+        if len(ids) < batch:
+            return total
+
+
+def backfill_days(db: Session) -> int:
+    """Give active bookings written before the day table their day rows (first writer wins on overlaps)."""
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+    rows = db.execute(
+        select(Booking).where(
+            Booking.status.in_(("requested", "confirmed")),
+            ~exists().where(VehicleDay.booking_id == Booking.id),
+        ).order_by(Booking.created_at)
+    ).scalars().all()
+    for b in rows:
+        try:
+            sd, ed = dt.date.fromisoformat(b.start_date), dt.date.fromisoformat(b.end_date)
+        except ValueError:
+            continue
+        days = rental_days(sd, ed)
+        if not days:
+            continue
+        hold = b.hold_expires_at if b.status == "requested" else None
+        db.execute(
+            pg_insert(VehicleDay.__table__)
+            .values([{"vehicle_id": b.vehicle_id, "day": d, "booking_id": b.id, "hold_expires_at": hold} for d in days])
+            .on_conflict_do_nothing()
+        )
+    db.commit()
+    return len(rows)
+
+
+# -- reads -----------------------------------------------------------------------
+
+
+def available_clause(vehicle_id_col, start: dt.date, end: dt.date, now: Optional[dt.datetime] = None):
+    """SQL filter: no blocking day row for the vehicle in ``[start, end)``."""
+    now = now or dt.datetime.utcnow()
+    return ~exists().where(
+        VehicleDay.vehicle_id == vehicle_id_col, VehicleDay.day >= start, VehicleDay.day < end, _taken(now),
+    )
+
+
+def is_available(db: Session, vehicle_id, start: dt.date, end: dt.date) -> bool:
+    return db.execute(select(available_clause(vehicle_id, start, end))).scalar()
+
+
+@dataclass
+class DayRange:
+    start: dt.date
+    end: dt.date  # exclusive
+    state: str  # booked|held|free
+    booking_id: Optional[str] = None
+
+    def to_dict(self, with_booking: bool = False) -> Dict:
+        out = {"start_date": self.start.isoformat(), "end_date": self.end.isoformat(), "state": self.state}
+        if with_booking and self.booking_id:
+            out["booking_id"] = self.booking_id
+        return out
+
+
+@dataclass
+class VehicleCalendar:
+    vehicle_id: str
+    ranges: List[DayRange] = field(default_factory=list)
+
+    @property
+    def free_days(self) -> int:
+        return sum((r.end - r.start).days for r in self.ranges if r.state == "free")
+
+
+def calendar(db: Session, vehicle_ids: Sequence, start: dt.date, end: dt.date, now: Optional[dt.datetime] = None) -> Dict[str, VehicleCalendar]:
+    """Busy and free ranges per vehicle over ``[start, end)``, from one query over the day table."""
+    now = now or dt.datetime.utcnow()
+    out = {str(v): VehicleCalendar(str(v)) for v in vehicle_ids}
+    if not out:
+        return out
+    rows = db.execute(
+        select(VehicleDay.vehicle_id, VehicleDay.day, VehicleDay.booking_id, VehicleDay.hold_expires_at)
+        .where(VehicleDay.vehicle_id.in_(list(vehicle_ids)), VehicleDay.day >= start, VehicleDay.day < end, _taken(now))
+        .order_by(VehicleDay.vehicle_id, VehicleDay.day)
+    ).all()
+    busy: Dict[str, List[DayRange]] = {k: [] for k in out}
+    for vid, day, bid, hold in rows:
+        state = "held" if hold is not None else "booked"
+        spans = busy[str(vid)]
+        last = spans[-1] if spans else None
+        if last is not None and last.end == day and last.booking_id == str(bid) and last.state == state:
+            last.end = day + dt.timedelta(days=1)
+        else:
+            spans.append(DayRange(day, day + dt.timedelta(days=1), state, str(bid)))
+    for vid, spans in busy.items():
+        cursor = start
+        for r in spans:
+            if r.start > cursor:
+                out[vid].ranges.append(DayRange(cursor, r.start, "free"))
+            out[vid].ranges.append(r)
+            cursor = r.end
+        if cursor < end:
+            out[vid].ranges.append(DayRange(cursor, end, "free"))
+    return out
+
@@ -40,6 +40,21 @@ class Settings:
     PAYMENTS_INTERNAL_SECRET: str = os.getenv("PAYMENTS_INTERNAL_SECRET", "")
     FEE_WALLET_PHONE: str = os.getenv("FEE_WALLET_PHONE", "+963000000000")
     PAYMENTS_WEBHOOK_SECRET: str = os.getenv("PAYMENTS_WEBHOOK_SECRET", "")
+    # Inbound Payments webhooks: PAYMENTS_WEBHOOK_SECRET may list "current,previous" during rotation;
+    # failed handlers are retried every WEBHOOK_RETRY_SWEEP_SECS and dead-lettered after WEBHOOK_MAX_ATTEMPTS
+    WEBHOOK_TOLERANCE_SECS: int = int(os.getenv("WEBHOOK_TOLERANCE_SECS", "300"))
+    WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+    WEBHOOK_RETRY_SWEEP_SECS: int = int(os.getenv("WEBHOOK_RETRY_SWEEP_SECS", "30"))
+    # Payment requests for bookings are retried every PAYMENT_SAGA_SWEEP_SECS; after PAYMENT_SAGA_MAX_ATTEMPTS the days are released
+    PAYMENT_SAGA_MAX_ATTEMPTS: int = int(os.getenv("PAYMENT_SAGA_MAX_ATTEMPTS", "8"))
+    PAYMENT_SAGA_SWEEP_SECS: int = int(os.getenv("PAYMENT_SAGA_SWEEP_SECS", "15"))
+
+    # Inventory: unpaid bookings hold their days this long (0 = no expiry); the sweeper expires lapsed holds
+    CARRENTAL_HOLD_MINUTES: int = int(os.getenv("CARRENTAL_HOLD_MINUTES", "30"))
+    CARRENTAL_HOLD_SWEEP_SECS: int = int(os.getenv("CARRENTAL_HOLD_SWEEP_SECS", "60"))
+    # First-page totals and facet counts are reused for this long per filter set (0 = always count)
+    CARRENTAL_SEARCH_COUNTS_TTL_SECS: float = float(os.getenv("CARRENTAL_SEARCH_COUNTS_TTL_SECS", "30"))
+    SCHEDULER_PARTITIONS: int = int(os.getenv("SCHEDULER_PARTITIONS", "1"))
 
     @property
     def jwt_expires_delta(self) -> timedelta:
@@ -3,7 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 
 from .config import settings
-from .database import engine
+from .database import engine, SessionLocal
 from .models import Base
 from .middleware_request_id import RequestIDMiddleware
 from .middleware_rate_limit import SlidingWindowLimiter, RedisRateLimiter
@@ -13,6 +13,51 @@ from .routers import market as market_router
 from .routers import payments_webhook as payments_webhook_router
 from .routers import admin as admin_router
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, sql_partition_clause, store_from_env
+
+
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler running the hold sweeper (unpaid bookings past hold_expires_at release their days), webhook retries and payment handoffs."""
+    from .availability import expire_holds
+    from .models import Booking
+
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="carrental", **kw)
+
+    def _expire(ctx):
+        with SessionLocal() as db:
+            return {"expired": expire_holds(db, where=sql_partition_clause(Booking.id, ctx))}
+
+    secs = settings.CARRENTAL_HOLD_SWEEP_SECS
+    sched.add_job(
+        "carrental_hold_expiry", _expire, IntervalTrigger(max(secs, 1)),
+        partitions=settings.SCHEDULER_PARTITIONS, lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+
+    def _webhooks(ctx):
+        from .routers.payments_webhook import inbox
+
+        out = inbox.process_due()
+        out["gc_deleted"] = inbox.gc()
+        return out
+
+    # One partition: claims skip rows another replica holds, so the whole backlog is shared safely
+    secs = settings.WEBHOOK_RETRY_SWEEP_SECS
+    sched.add_job(
+        "carrental_webhook_retry", _webhooks, IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+
+    def _payment_sagas(ctx):
+        from .payment_saga import saga
+
+        return saga.process_due()
+
+    secs = settings.PAYMENT_SAGA_SWEEP_SECS
+    sched.add_job(
+        "carrental_payment_saga", _payment_sagas, IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    return sched
 
 
 def create_app() -> FastAPI:
@@ -45,6 +90,24 @@ def create_app() -> FastAPI:
 
     if settings.AUTO_CREATE_SCHEMA:
         Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE carrental_bookings ADD COLUMN IF NOT EXISTS hold_expires_at TIMESTAMP")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_carrental_bookings_hold ON carrental_bookings (status, hold_expires_at)")
+            conn.exec_driver_sql("ALTER TABLE carrental_vehicles ADD COLUMN IF NOT EXISTS make_id INTEGER REFERENCES carrental_makes (id)")
+            conn.exec_driver_sql("ALTER TABLE carrental_vehicles ADD COLUMN IF NOT EXISTS model_id INTEGER REFERENCES carrental_models (id)")
+            conn.exec_driver_sql("ALTER TABLE carrental_vehicles ADD COLUMN IF NOT EXISTS location_id INTEGER REFERENCES carrental_locations (id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_carrental_vehicles_price ON carrental_vehicles (status, price_per_day_cents, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_carrental_vehicles_created ON carrental_vehicles (status, created_at, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_carrental_vehicles_make ON carrental_vehicles (make_id, status, price_per_day_cents, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_carrental_vehicles_model ON carrental_vehicles (model_id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_carrental_vehicles_location ON carrental_vehicles (location_id, status, price_per_day_cents, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_carrental_vehicles_location_created ON carrental_vehicles (location_id, status, created_at, id)")
+        # Bookings made before the day table get their day rows; vehicles before the search dimensions get their ids
+        from .availability import backfill_days
+        from .search import backfill_dimensions
+        with SessionLocal() as db:
+            backfill_days(db)
+            backfill_dimensions(db)
 
     @app.get("/health")
     def health():
@@ -83,6 +146,9 @@ def create_app() -> FastAPI:
     app.include_router(market_router.router)
     app.include_router(payments_webhook_router.router)
     app.include_router(admin_router.router)
+
+    if settings.CARRENTAL_HOLD_SWEEP_SECS > 0 or settings.WEBHOOK_RETRY_SWEEP_SECS > 0 or settings.PAYMENT_SAGA_SWEEP_SECS > 0:
+        install_scheduler(app, build_scheduler())
     return app
 
 
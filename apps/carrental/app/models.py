@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, ForeignKey, Text, UniqueConstraint
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Integer, Date, DateTime, Boolean, ForeignKey, Index, Text, UniqueConstraint, event, inspect, select
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
 from sqlalchemy.orm import declarative_base, relationship
 
 
@@ -12,6 +12,11 @@ def default_uuid():
     return uuid.uuid4()
 
 
+def normalize_term(value):
+    """Search key for a make/model/location: trimmed, inner whitespace collapsed, lower-cased."""
+    return " ".join(value.split()).lower() if value else ""
+
+
 class User(Base):
     __tablename__ = "carrental_users"
 
@@ -39,8 +44,45 @@ class Company(Base):
     vehicles = relationship("Vehicle", back_populates="company")
 
 
+class Make(Base):
+    __tablename__ = "carrental_makes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    key = Column(String(64), nullable=False, unique=True)
+    name = Column(String(64), nullable=False)
+
+
+class Model(Base):
+    __tablename__ = "carrental_models"
+    __table_args__ = (
+        UniqueConstraint("make_id", "key", name="uq_carrental_models_make_key"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    make_id = Column(Integer, ForeignKey("carrental_makes.id"), nullable=False)
+    key = Column(String(64), nullable=False)
+    name = Column(String(64), nullable=False)
+
+
+class Location(Base):
+    __tablename__ = "carrental_locations"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    key = Column(String(128), nullable=False, unique=True)
+    name = Column(String(128), nullable=False)
+
+
 class Vehicle(Base):
     __tablename__ = "carrental_vehicles"
+    # Browse walks these in (sort, id) order; make/location pages start from their dimension id
+    __table_args__ = (
+        Index("ix_carrental_vehicles_price", "status", "price_per_day_cents", "id"),
+        Index("ix_carrental_vehicles_created", "status", "created_at", "id"),
+        Index("ix_carrental_vehicles_make", "make_id", "status", "price_per_day_cents", "id"),
+        Index("ix_carrental_vehicles_model", "model_id"),
+        Index("ix_carrental_vehicles_location", "location_id", "status", "price_per_day_cents", "id"),
+        Index("ix_carrental_vehicles_location_created", "location_id", "status", "created_at", "id"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     company_id = Column(UUID(as_uuid=True), ForeignKey("carrental_companies.id"), nullable=False)
@@ -53,11 +95,44 @@ class Vehicle(Base):
     price_per_day_cents = Column(Integer, nullable=False)
     status = Column(String(16), nullable=False, default="available")  # available|unavailable
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Normalized make/model/location for indexed search; kept in sync on write
+    make_id = Column(Integer, ForeignKey("carrental_makes.id"), nullable=True)
+    model_id = Column(Integer, ForeignKey("carrental_models.id"), nullable=True)
+    location_id = Column(Integer, ForeignKey("carrental_locations.id"), nullable=True)
 
     company = relationship("Company", back_populates="vehicles")
     bookings = relationship("Booking", back_populates="vehicle")
 
 
+def _dimension_id(connection, table, name, **keys):
+    row_id = connection.execute(select(table.c.id).filter_by(**keys)).scalar()
+    if row_id is None:
+        # Concurrent writers of the same new term: one insert wins, the rest read its id
+        row_id = connection.execute(
+            pg_insert(table).values(name=" ".join(name.split()), **keys).on_conflict_do_nothing().returning(table.c.id)
+        ).scalar()
+    if row_id is None:
+        row_id = connection.execute(select(table.c.id).filter_by(**keys)).scalar()
+    return row_id
+
+
+@event.listens_for(Vehicle, "before_insert")
+def _vehicle_dimensions(mapper, connection, target):
+    make_key = normalize_term(target.make)
+    target.make_id = _dimension_id(connection, Make.__table__, target.make, key=make_key) if make_key else None
+    model_key = normalize_term(target.model)
+    target.model_id = _dimension_id(connection, Model.__table__, target.model, make_id=target.make_id, key=model_key) if model_key and target.make_id else None
+    location_key = normalize_term(target.location)
+    target.location_id = _dimension_id(connection, Location.__table__, target.location, key=location_key) if location_key else None
+
+
+@event.listens_for(Vehicle, "before_update")
+def _vehicle_dimensions_changed(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[a].history.has_changes() for a in ("make", "model", "location")):
+        _vehicle_dimensions(mapper, connection, target)
+
+
 class VehicleImage(Base):
     __tablename__ = "carrental_vehicle_images"
 
@@ -70,6 +145,9 @@ class VehicleImage(Base):
 
 class Booking(Base):
     __tablename__ = "carrental_bookings"
+    __table_args__ = (
+        Index("ix_carrental_bookings_hold", "status", "hold_expires_at"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     user_id = Column(UUID(as_uuid=True), ForeignKey("carrental_users.id"), nullable=False)
@@ -78,15 +156,33 @@ class Booking(Base):
     end_date = Column(String(16), nullable=False)
     days = Column(Integer, nullable=False)
     total_cents = Column(Integer, nullable=False)
-    status = Column(String(16), nullable=False, default="requested")  # requested|confirmed|canceled
+    status = Column(String(16), nullable=False, default="requested")  # requested|confirmed|canceled|expired
     payment_request_id = Column(String(64), nullable=True)
     payment_transfer_id = Column(String(64), nullable=True)
+    # Unpaid (requested) bookings hold their days until then; None once confirmed
+    hold_expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     user = relationship("User", back_populates="bookings")
     vehicle = relationship("Vehicle", back_populates="bookings")
 
 
+class VehicleDay(Base):
+    """One row per vehicle and rental day taken by a booking; the primary key makes double booking impossible."""
+
+    __tablename__ = "carrental_vehicle_days"
+    __table_args__ = (
+        Index("ix_carrental_vehicle_days_booking", "booking_id"),
+        Index("ix_carrental_vehicle_days_day", "day"),
+    )
+
+    vehicle_id = Column(UUID(as_uuid=True), ForeignKey("carrental_vehicles.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    booking_id = Column(UUID(as_uuid=True), ForeignKey("carrental_bookings.id", ondelete="CASCADE"), nullable=False)
+    # Copy of the booking's hold, so availability reads need no join
+    hold_expires_at = Column(DateTime, nullable=True)
+
+
 class FavoriteVehicle(Base):
     __tablename__ = "carrental_fav_vehicles"
     __table_args__ = (
@@ -0,0 +1,48 @@
+"""Payment handoff for rentals (see ``superapp_shared.payment_saga``).
+
+The saga row is written with the booking's day holds, sent right after the
+commit and retried by the ``carrental_payment_saga`` job. If Payments never
+takes the request, the booking expires and its days are freed, the same end
+state as a lapsed hold.
+"""
+from __future__ import annotations
+
+import uuid
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from superapp_shared.payment_saga import PaymentSaga, SagaRecord, register_prometheus_collector
+
+from . import availability
+from .config import settings
+from .database import SessionLocal
+from .models import Booking
+
+saga = PaymentSaga(
+    "carrental",
+    SessionLocal,
+    base_url=lambda: settings.PAYMENTS_BASE_URL,
+    secret=lambda: settings.PAYMENTS_INTERNAL_SECRET,
+    max_attempts=settings.PAYMENT_SAGA_MAX_ATTEMPTS,
+)
+register_prometheus_collector()
+
+
+@saga.on_requested("booking")
+def _requested(db: Session, rec: SagaRecord):
+    # An expired hold may still be paid for (confirm re-takes free days); a canceled booking may not
+    linked = db.execute(
+        update(Booking).where(Booking.id == uuid.UUID(rec.ref_id), Booking.status != "canceled")
+        .values(payment_request_id=rec.payment_request_id).execution_options(synchronize_session=False)
+    ).rowcount
+    return bool(linked)
+
+
+@saga.on_failed("booking")
+def _release(db: Session, rec: SagaRecord) -> None:
+    b = db.execute(select(Booking).where(Booking.id == uuid.UUID(rec.ref_id)).with_for_update()).scalars().first()
+    # Confirmed, canceled or already expired: nothing is held for this payment any more
+    if b is None or b.status != "requested":
+        return
+    availability.release(db, b, status="expired")
@@ -4,7 +4,10 @@ from sqlalchemy.orm import Session
 from ..auth import get_current_user
 from ..database import get_db
 from ..models import User, Company, Vehicle, Booking, VehicleImage
-from ..schemas import CompanyCreateIn, CompanyOut, VehicleCreateIn, VehicleUpdateIn, VehicleOut, BookingsListOut, BookingOut, VehicleImageCreateIn, VehicleImageOut
+from ..schemas import CompanyCreateIn, CompanyOut, VehicleCreateIn, VehicleUpdateIn, VehicleOut, BookingsListOut, BookingOut, VehicleImageCreateIn, VehicleImageOut, CalendarOut
+from .. import availability
+from ..payment_saga import saga as payment_saga
+from .market import calendar_out, calendar_window
 
 
 router = APIRouter(prefix="", tags=["company"])  # company + seller vehicles
@@ -94,6 +97,16 @@ def company_orders(user: User = Depends(get_current_user), db: Session = Depends
     return BookingsListOut(bookings=[BookingOut(id=str(b.id), vehicle_id=str(b.vehicle_id), start_date=b.start_date, end_date=b.end_date, days=b.days, total_cents=b.total_cents, status=b.status, created_at=b.created_at) for b in rows])
 
 
+@router.get("/orders/calendar", response_model=CalendarOut)
+def company_calendar(from_date: str | None = None, to_date: str | None = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Fleet calendar: every company vehicle's booked/held/free ranges, with booking ids."""
+    _require_seller(user)
+    sd, ed = calendar_window(from_date, to_date)
+    c = db.query(Company).filter(Company.owner_user_id == user.id).one_or_none()
+    vids = [vid for (vid,) in db.query(Vehicle.id).filter(Vehicle.company_id == c.id).order_by(Vehicle.created_at).all()] if c else []
+    return calendar_out(db, vids, sd, ed, with_booking=True)
+
+
 @router.delete("/vehicles/{vehicle_id}")
 def delete_vehicle(vehicle_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _require_seller(user)
@@ -167,8 +180,11 @@ def confirm_booking(booking_id: str, user: User = Depends(get_current_user), db:
         raise HTTPException(status_code=403, detail="Forbidden")
     if b.status == "canceled":
         raise HTTPException(status_code=400, detail="Booking canceled")
-    b.status = "confirmed"
-    db.flush()
+    if b.status != "confirmed":
+        try:
+            availability.confirm(db, b)
+        except availability.Unavailable:
+            raise HTTPException(status_code=400, detail="Hold expired and the dates were taken")
     return BookingOut(id=str(b.id), vehicle_id=str(b.vehicle_id), start_date=b.start_date, end_date=b.end_date, days=b.days, total_cents=b.total_cents, status=b.status, created_at=b.created_at)
 
 
@@ -186,6 +202,8 @@ def cancel_booking(booking_id: str, user: User = Depends(get_current_user), db:
         raise HTTPException(status_code=403, detail="Forbidden")
     if b.status == "canceled":
         return BookingOut(id=str(b.id), vehicle_id=str(b.vehicle_id), start_date=b.start_date, end_date=b.end_date, days=b.days, total_cents=b.total_cents, status=b.status, created_at=b.created_at)
-    b.status = "canceled"
-    db.flush()
+    availability.release(db, b)
+    # Not sent yet: never ask for it. Already recorded: withdraw it; still in flight: withdrawn once recorded
+    if not payment_saga.cancel(db, "booking", b.id):
+        payment_saga.void(db, "booking", b.id)
     return BookingOut(id=str(b.id), vehicle_id=str(b.vehicle_id), start_date=b.start_date, end_date=b.end_date, days=b.days, total_cents=b.total_cents, status=b.status, created_at=b.created_at)
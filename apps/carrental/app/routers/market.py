@@ -1,74 +1,154 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
-import httpx
+import datetime as dt
 from uuid import UUID
 
 from ..auth import get_current_user
 from ..database import get_db
 from ..models import User, Company, Vehicle, Booking, FavoriteVehicle
-from ..schemas import VehiclesListOut, VehicleOut, BookingCreateIn, BookingOut, BookingsListOut
+from ..schemas import VehiclesListOut, VehicleOut, BookingCreateIn, BookingOut, BookingsListOut, CalendarOut, DayRangeOut, VehicleCalendarOut
+from .. import availability, search
 from ..utils import notify
 from ..config import settings
-from superapp_shared.internal_hmac import sign_internal_request_headers
+from ..payment_saga import saga as payment_saga
 
 
 router = APIRouter(prefix="/market", tags=["market"]) 
 
+CALENDAR_MAX_VEHICLES = 100
+CALENDAR_DEFAULT_DAYS = 90
+
+
+def _vehicle_out(v: Vehicle) -> VehicleOut:
+    return VehicleOut(id=str(v.id), company_id=str(v.company_id), make=v.make, model=v.model, year=v.year, transmission=v.transmission, seats=v.seats, location=v.location, price_per_day_cents=v.price_per_day_cents, status=v.status, created_at=v.created_at)
+
+
+def _booking_out(b: Booking) -> BookingOut:
+    return BookingOut(id=str(b.id), vehicle_id=str(b.vehicle_id), start_date=b.start_date, end_date=b.end_date, days=b.days, total_cents=b.total_cents, status=b.status, created_at=b.created_at, hold_expires_at=b.hold_expires_at)
+
+
+def _range_or_400(start_date: str, end_date: str, max_days: int = availability.MAX_RANGE_DAYS):
+    try:
+        return availability.parse_range(start_date, end_date, max_days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def calendar_window(from_date: str | None, to_date: str | None):
+    """Calendar window: defaults to the next CALENDAR_DEFAULT_DAYS days."""
+    sd = from_date or dt.date.today().isoformat()
+    if not to_date:
+        try:
+            to_date = (dt.date.fromisoformat(sd) + dt.timedelta(days=CALENDAR_DEFAULT_DAYS)).isoformat()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid dates")
+    return _range_or_400(sd, to_date)
+
+
+def calendar_out(db: Session, vehicle_ids, sd: dt.date, ed: dt.date, with_booking: bool = False) -> CalendarOut:
+    cals = availability.calendar(db, vehicle_ids, sd, ed)
+    return CalendarOut(from_date=sd.isoformat(), to_date=ed.isoformat(), vehicles=[
+        VehicleCalendarOut(vehicle_id=c.vehicle_id, free_days=c.free_days, ranges=[DayRangeOut(**r.to_dict(with_booking)) for r in c.ranges])
+        for c in cals.values()
+    ])
+
+
+def _id_list(raw: str | None, name: str) -> list:
+    try:
+        return [int(x) for x in raw.split(",") if x.strip()] if raw else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+
+
+def _vehicles_page(db: Session, s: search.VehicleSearch, sort: str, sort_dir: str, cursor, limit: int, offset: int, facets: bool) -> VehiclesListOut:
+    if sort not in search.SORTS or sort_dir not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid sort")
+    try:
+        page = search.page(db, s, sort=sort, direction=sort_dir, cursor=cursor, limit=limit, offset=offset, with_total=not cursor)
+    except search.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return VehiclesListOut(
+        vehicles=[_vehicle_out(v) for v in page.vehicles], total=page.total, next_cursor=page.next_cursor,
+        facets=search.facet_counts(db, s) if facets and not cursor else None,
+    )
+
 
 @router.get("/vehicles", response_model=VehiclesListOut)
 def browse_vehicles(
     q: str | None = None,
     location: str | None = None,
     make: str | None = None,
+    model: str | None = None,
+    make_ids: str | None = Query(None, description="comma-separated make ids (from facets)"),
+    location_ids: str | None = Query(None, description="comma-separated location ids (from facets)"),
     transmission: str | None = None,
     seats_min: int | None = Query(None, ge=1),
     min_price: int | None = Query(None, ge=0),
     max_price: int | None = Query(None, ge=0),
+    year_min: int | None = Query(None, ge=1900),
+    year_max: int | None = Query(None, ge=1900),
     start_date: str | None = None,
     end_date: str | None = None,
     limit: int = Query(20, gt=0, le=100),
-    offset: int = Query(0, ge=0),
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    offset: int = Query(0, ge=0, description="ignored with a cursor"),
     sort_by: str | None = Query(None, description="price|created"),
     sort_dir: str | None = Query(None, description="asc|desc"),
+    facets: bool = Query(False, description="facet counts on the first page"),
     db: Session = Depends(get_db),
 ):
-    query = db.query(Vehicle).filter(Vehicle.status == "available")
-    if q:
-        like = f"%{q}%"
-        query = query.filter(or_(Vehicle.make.ilike(like), Vehicle.model.ilike(like), Vehicle.location.ilike(like)))
-    if location:
-        query = query.filter(Vehicle.location.ilike(f"%{location}%"))
-    if make:
-        query = query.filter(Vehicle.make.ilike(f"%{make}%"))
-    if transmission:
-        query = query.filter(Vehicle.transmission == transmission)
-    if seats_min is not None:
-        query = query.filter(Vehicle.seats.is_(None) | (Vehicle.seats >= seats_min))
-    if min_price is not None:
-        query = query.filter(Vehicle.price_per_day_cents >= min_price)
-    if max_price is not None:
-        query = query.filter(Vehicle.price_per_day_cents <= max_price)
-    # date availability: ensure no overlapping booking exists
+    """Available vehicles, keyset-paginated: pass ``next_cursor`` back as ``cursor`` for the next page."""
+    s = search.VehicleSearch(
+        q=q, make=make, model=model, location=location, make_ids=_id_list(make_ids, "make_ids"), location_ids=_id_list(location_ids, "location_ids"),
+        transmission=transmission, seats_min=seats_min, min_price=min_price, max_price=max_price, year_min=year_min, year_max=year_max,
+    )
+    # date availability: no taken day (booked or held) in [start_date, end_date)
     if start_date and end_date:
-        sub = db.query(Booking.vehicle_id).filter(
-            Booking.status != "canceled",
-            # overlap if (start <= end2) and (end >= start2)
-            and_(Booking.start_date <= end_date, Booking.end_date >= start_date),
-        ).subquery()
-        query = query.filter(~Vehicle.id.in_(sub))
-    total = query.count()
-    # Sorting
-    order = Vehicle.created_at.desc()
-    if sort_by == "price":
-        order = Vehicle.price_per_day_cents.asc() if sort_dir == "asc" else Vehicle.price_per_day_cents.desc()
-    elif sort_by == "created":
-        order = Vehicle.created_at.asc() if sort_dir == "asc" else Vehicle.created_at.desc()
-    rows = query.order_by(order).limit(limit).offset(offset).all()
-    return VehiclesListOut(vehicles=[
-        VehicleOut(id=str(v.id), company_id=str(v.company_id), make=v.make, model=v.model, year=v.year, transmission=v.transmission, seats=v.seats, location=v.location, price_per_day_cents=v.price_per_day_cents, status=v.status, created_at=v.created_at)
-        for v in rows
-    ], total=total)
+        s.start, s.end = _range_or_400(start_date, end_date)
+    return _vehicles_page(db, s, sort_by or "created", sort_dir or "desc", cursor, limit, offset, facets)
+
+
+@router.get("/availability", response_model=VehiclesListOut)
+def search_availability(
+    start_date: str,
+    end_date: str,
+    q: str | None = None,
+    location: str | None = None,
+    make: str | None = None,
+    transmission: str | None = None,
+    seats_min: int | None = Query(None, ge=1),
+    min_price: int | None = Query(None, ge=0),
+    max_price: int | None = Query(None, ge=0),
+    limit: int = Query(20, gt=0, le=100),
+    cursor: str | None = None,
+    offset: int = Query(0, ge=0),
+    facets: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Vehicles free on every day of [start_date, end_date), cheapest first."""
+    sd, ed = _range_or_400(start_date, end_date)
+    s = search.VehicleSearch(
+        q=q, make=make, location=location, transmission=transmission, seats_min=seats_min, min_price=min_price, max_price=max_price, start=sd, end=ed,
+    )
+    return _vehicles_page(db, s, "price", "asc", cursor, limit, offset, facets)
+
+
+@router.get("/calendar", response_model=CalendarOut)
+def vehicles_calendar(
+    vehicle_ids: str = Query(..., description="comma-separated vehicle ids"),
+    from_date: str | None = None,
+    to_date: str | None = None,
+    db: Session = Depends(get_db),
+):
+    """Booked/held/free day ranges for up to CALENDAR_MAX_VEHICLES vehicles in one read."""
+    try:
+        ids = list(dict.fromkeys(UUID(x.strip()) for x in vehicle_ids.split(",") if x.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid vehicle_ids")
+    if not ids or len(ids) > CALENDAR_MAX_VEHICLES:
+        raise HTTPException(status_code=400, detail=f"Pass 1..{CALENDAR_MAX_VEHICLES} vehicle_ids")
+    sd, ed = calendar_window(from_date, to_date)
+    return calendar_out(db, ids, sd, ed)
 
 
 @router.get("/vehicles/favorites", response_model=VehiclesListOut)
@@ -78,10 +158,7 @@ def list_favorites(user: User = Depends(get_current_user), db: Session = Depends
     if not ids:
         return VehiclesListOut(vehicles=[], total=0)
     vs = db.query(Vehicle).filter(Vehicle.id.in_(ids), Vehicle.status == "available").all()
-    return VehiclesListOut(vehicles=[
-        VehicleOut(id=str(v.id), company_id=str(v.company_id), make=v.make, model=v.model, year=v.year, transmission=v.transmission, seats=v.seats, location=v.location, price_per_day_cents=v.price_per_day_cents, status=v.status, created_at=v.created_at)
-        for v in vs
-    ], total=len(vs))
+    return VehiclesListOut(vehicles=[_vehicle_out(v) for v in vs], total=len(vs))
 
 
 @router.get("/vehicles/{vehicle_id}", response_model=VehicleOut)
@@ -89,7 +166,7 @@ def vehicle_details(vehicle_id: UUID, db: Session = Depends(get_db)):
     v = db.get(Vehicle, vehicle_id)
     if not v:
         raise HTTPException(status_code=404, detail="Vehicle not found")
-    return VehicleOut(id=str(v.id), company_id=str(v.company_id), make=v.make, model=v.model, year=v.year, transmission=v.transmission, seats=v.seats, location=v.location, price_per_day_cents=v.price_per_day_cents, status=v.status, created_at=v.created_at)
+    return _vehicle_out(v)
 
 
 @router.post("/vehicles/{vehicle_id}/book", response_model=BookingOut)
@@ -97,55 +174,44 @@ def create_booking(vehicle_id: UUID, payload: BookingCreateIn, user: User = Depe
     v = db.get(Vehicle, vehicle_id)
     if not v or v.status != "available":
         raise HTTPException(status_code=404, detail="Vehicle not available")
-    # compute days
-    import datetime as dt
+    sd, ed = _range_or_400(payload.start_date, payload.end_date)
+    # The day rows are the overlap check: a concurrent booking for any of these days fails on insert
     try:
-        sd = dt.date.fromisoformat(payload.start_date)
-        ed = dt.date.fromisoformat(payload.end_date)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid dates")
-    if ed <= sd:
-        raise HTTPException(status_code=400, detail="end_date must be after start_date")
-    days = (ed - sd).days
-    # availability check
-    overlap = (
-        db.query(Booking)
-        .filter(
-            Booking.vehicle_id == v.id,
-            Booking.status != "canceled",
-            and_(Booking.start_date <= payload.end_date, Booking.end_date >= payload.start_date),
-        )
-        .count()
-    )
-    if overlap:
+        b = availability.reserve(db, v, user.id, sd, ed)
+    except availability.Unavailable:
         raise HTTPException(status_code=400, detail="Vehicle not available for given dates")
-    total = days * int(v.price_per_day_cents)
-    b = Booking(user_id=user.id, vehicle_id=v.id, start_date=payload.start_date, end_date=payload.end_date, days=days, total_cents=total, status="requested")
-    db.add(b)
-    db.flush()
-    # Optional payments handoff
-    try:
-        if settings.PAYMENTS_BASE_URL and settings.PAYMENTS_INTERNAL_SECRET and total > 0:
-            payload_json = {"from_phone": user.phone, "to_phone": settings.FEE_WALLET_PHONE, "amount_cents": total}
-            headers = sign_internal_request_headers(payload_json, settings.PAYMENTS_INTERNAL_SECRET, "")
-            with httpx.Client(timeout=5.0) as client:
-                r = client.post(f"{settings.PAYMENTS_BASE_URL}/internal/requests", headers=headers, json=payload_json)
-                if r.status_code < 400:
-                    b.payment_request_id = r.json().get("id")
-                    db.flush()
-    except Exception:
-        pass
+    saga_id = None
+    if b.total_cents > 0 and payment_saga.enabled:
+        # Recorded with the day holds, so a Payments outage retries it instead of losing it
+        saga_id = payment_saga.begin(
+            db, "booking", b.id, from_phone=user.phone, to_phone=settings.FEE_WALLET_PHONE, amount_cents=b.total_cents,
+            metadata={"booking_id": str(b.id), "service": "carrental"},
+        )
+    # Release the day locks before the remote call; the hold keeps the days until paid or expired
+    db.commit()
+    if saga_id:
+        payment_saga.dispatch(saga_id)
+        db.refresh(b)
     notify("booking.created", {"booking_id": str(b.id)})
-    return BookingOut(id=str(b.id), vehicle_id=str(b.vehicle_id), start_date=b.start_date, end_date=b.end_date, days=b.days, total_cents=b.total_cents, status=b.status, created_at=b.created_at)
+    return _booking_out(b)
 
 
 @router.get("/bookings", response_model=BookingsListOut)
 def my_bookings(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     rows = db.query(Booking).filter(Booking.user_id == user.id).order_by(Booking.created_at.desc()).all()
-    return BookingsListOut(bookings=[
-        BookingOut(id=str(b.id), vehicle_id=str(b.vehicle_id), start_date=b.start_date, end_date=b.end_date, days=b.days, total_cents=b.total_cents, status=b.status, created_at=b.created_at)
-        for b in rows
-    ])
+    return BookingsListOut(bookings=[_booking_out(b) for b in rows])
+
+
+@router.get("/bookings/{booking_id}/payment")
+def booking_payment(booking_id: UUID, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Where the payment handoff stands: pending (being retried), requested, compensated (days released) or canceled."""
+    b = db.get(Booking, booking_id)
+    if not b or b.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    rec = payment_saga.status(db, "booking", b.id)
+    if rec is not None:
+        return rec.to_dict()
+    return {"status": "requested" if b.payment_request_id else "none", "payment_request_id": b.payment_request_id, "amount_cents": b.total_cents, "attempts": 0, "next_attempt_at": None}
 
 
 @router.get("/vehicles/{vehicle_id}/availability")
@@ -153,13 +219,12 @@ def vehicle_availability(vehicle_id: UUID, from_date: str | None = None, to_date
     v = db.get(Vehicle, vehicle_id)
     if not v:
         raise HTTPException(status_code=404, detail="Vehicle not found")
-    q = db.query(Booking).filter(Booking.vehicle_id == v.id, Booking.status != "canceled")
-    if from_date:
-        q = q.filter(Booking.end_date >= from_date)
-    if to_date:
-        q = q.filter(Booking.start_date <= to_date)
-    rows = q.order_by(Booking.start_date.asc()).all()
-    return {"booked": [{"start_date": b.start_date, "end_date": b.end_date} for b in rows]}
+    sd, ed = calendar_window(from_date, to_date)
+    cal = availability.calendar(db, [v.id], sd, ed)[str(v.id)]
+    return {
+        "booked": [r.to_dict() for r in cal.ranges if r.state != "free"],
+        "free": [r.to_dict() for r in cal.ranges if r.state == "free"],
+    }
 
 
 @router.post("/vehicles/{vehicle_id}/favorite")
@@ -1,49 +1,47 @@
-import hmac
-import hashlib
-import json
-from fastapi import APIRouter, Header, HTTPException, status, Depends
-from sqlalchemy.orm import Session
+import logging
+from fastapi import APIRouter, BackgroundTasks, Request
+
+from superapp_shared.webhook_inbox import InboundEvent, WebhookInbox, parse_secrets, register_prometheus_collector, webhook_inbox_store_from_env
 
 from ..config import settings
-from ..database import get_db
+from ..database import SessionLocal, engine
 from ..models import Booking
+from .. import availability
 
+log = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/payments", tags=["payments-webhook"])
 
-
-def _verify(ts: str, event: str, body: bytes, sign: str) -> bool:
-    secret = getattr(settings, "PAYMENTS_WEBHOOK_SECRET", None)
-    if not secret:
-        return False
-    expect = hmac.new(secret.encode("utf-8"), (ts + event).encode("utf-8") + body, hashlib.sha256).hexdigest()
-    try:
-        return hmac.compare_digest(expect, sign)
-    except Exception:
-        return False
+# Signature over the raw body, replay window and event-id dedupe; handlers run after the ack
+inbox = WebhookInbox(
+    "carrental",
+    webhook_inbox_store_from_env(engine),
+    secrets=lambda: parse_secrets(settings.PAYMENTS_WEBHOOK_SECRET),
+    tolerance_secs=settings.WEBHOOK_TOLERANCE_SECS,
+    max_attempts=settings.WEBHOOK_MAX_ATTEMPTS,
+)
+register_prometheus_collector()
+
+
+@inbox.on("requests.accept", "requests.accepted")
+def _request_accepted(ev: InboundEvent) -> None:
+    pr_id = ev.data.get("id")
+    transfer_id = ev.data.get("transfer_id")
+    if not pr_id:
+        return
+    with SessionLocal() as db:
+        b = db.query(Booking).filter(Booking.payment_request_id == pr_id).one_or_none()
+        if b is not None and b.status not in ("confirmed", "canceled"):
+            try:
+                availability.confirm(db, b)
+            except availability.Unavailable:
+                # Paid after the hold lapsed and someone else took the dates; leave it expired for a refund
+                log.warning("booking %s paid after hold expiry; dates taken", b.id)
+            if transfer_id:
+                b.payment_transfer_id = transfer_id
+            db.commit()
 
 
 @router.post("/webhooks")
-def receive_webhook(
-    payload: dict,
-    db: Session = Depends(get_db),
-    ts: str | None = Header(default=None, alias="X-Webhook-Ts"),
-    event: str | None = Header(default=None, alias="X-Webhook-Event"),
-    sign: str | None = Header(default=None, alias="X-Webhook-Sign"),
-):
-    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
-    if not ts or not event or not sign or not _verify(ts, event, raw, sign):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid signature")
-    if payload.get("type") in ("requests.accept", "requests.accepted"):
-        data = payload.get("data", {})
-        pr_id = data.get("id")
-        transfer_id = data.get("transfer_id")
-        if pr_id:
-            b = db.query(Booking).filter(Booking.payment_request_id == pr_id).one_or_none()
-            if b is not None and b.status != "confirmed":
-                b.status = "confirmed"
-                if transfer_id:
-                    b.payment_transfer_id = transfer_id
-                db.flush()
-    return {"detail": "ok"}
-
+async def receive_webhook(request: Request, background: BackgroundTasks):
+    return await inbox.receive_request(request, background)
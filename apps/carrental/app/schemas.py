@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 from pydantic import BaseModel, Field
 
 
@@ -65,9 +65,20 @@ class VehicleOut(BaseModel):
     created_at: datetime
 
 
+class FacetValueOut(BaseModel):
+    value: str  # make/location id, transmission, seats, or price band "min-max" (open-ended: "min-")
+    label: Optional[str] = None
+    count: int
+    min_cents: Optional[int] = None
+    max_cents: Optional[int] = None
+
+
 class VehiclesListOut(BaseModel):
     vehicles: List[VehicleOut]
-    total: int
+    # Counted on the first page only (no cursor)
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+    facets: Optional[Dict[str, List[FacetValueOut]]] = None
 
 
 class BookingCreateIn(BaseModel):
@@ -84,6 +95,7 @@ class BookingOut(BaseModel):
     total_cents: int
     status: str
     created_at: datetime
+    hold_expires_at: Optional[datetime] = None
 
 
 class BookingsListOut(BaseModel):
@@ -106,3 +118,22 @@ class VehicleImageOut(BaseModel):
 class BookedRangeOut(BaseModel):
     start_date: str
     end_date: str
+
+
+class DayRangeOut(BaseModel):
+    start_date: str
+    end_date: str  # exclusive (return day)
+    state: str  # booked|held|free
+    booking_id: Optional[str] = None
+
+
+class VehicleCalendarOut(BaseModel):
+    vehicle_id: str
+    free_days: int
+    ranges: List[DayRangeOut]
+
+
+class CalendarOut(BaseModel):
+    from_date: str
+    to_date: str
+    vehicles: List[VehicleCalendarOut]
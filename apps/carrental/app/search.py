@@ -0,0 +1,263 @@
+"""Vehicle search: normalized dimensions, keyset pages and facet counts.
+
+Make, model and location are normalized (``models.normalize_term``) into the
+``carrental_makes`` / ``carrental_models`` / ``carrental_locations`` tables
+when a vehicle is written, and vehicles carry the integer ids. Text filters
+match against those small tables and become ``make_id IN (...)`` style
+filters on the vehicle table, served by its composite browse indexes.
+
+Pages are keyset-paginated on ``(sort column, id)``: the opaque
+``next_cursor`` resumes after the last row returned, so a deep page costs
+what the first one does and rows added meanwhile do not shift pages. Date
+availability is the ``availability.available_clause`` anti-join against the
+day table's primary key.
+
+Facet counts use the same filters minus the facet's own, so each option
+shows how many vehicles picking it would give.
+"""
+from __future__ import annotations
+
+import datetime as dt
+from dataclasses import astuple, dataclass
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import case, false, func, or_, select, text, tuple_
+from sqlalchemy.orm import Session
+
+from superapp_shared.cache import BoundedTTLCache
+from superapp_shared.listing import InvalidCursor, decode_cursor, encode_cursor
+
+from . import availability
+from .config import settings
+from .models import Location, Make, Model, Vehicle, normalize_term
+
+SORTS = {"price": Vehicle.price_per_day_cents, "created": Vehicle.created_at}
+FACETS = ("make", "location", "transmission", "seats", "price")
+FACET_LIMIT = 20
+# Daily price bands (cents) for the price facet; the last one is open-ended
+PRICE_BANDS = (0, 10000, 20000, 30000, 50000, 100000)
+
+
+# Counting every match is the expensive part of a broad search; pages themselves are not cached
+_counts = BoundedTTLCache("carrental_search_counts", maxsize=2048, ttl=max(settings.CARRENTAL_SEARCH_COUNTS_TTL_SECS, 1))
+
+
+@dataclass
+class VehicleSearch:
+    """Browse filters; names match the ``/market/vehicles`` query parameters."""
+
+    q: Optional[str] = None
+    make: Optional[str] = None
+    model: Optional[str] = None
+    location: Optional[str] = None
+    make_ids: Sequence[int] = ()
+    location_ids: Sequence[int] = ()
+    transmission: Optional[str] = None
+    seats_min: Optional[int] = None
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    start: Optional[dt.date] = None
+    end: Optional[dt.date] = None
+
+    def cache_key(self) -> tuple:
+        return tuple(tuple(v) if isinstance(v, (list, tuple)) else v for v in astuple(self))
+
+    def clauses(self, db: Session) -> Dict[str, list]:
+        """Filters keyed by the facet they narrow (``base`` for the rest)."""
+        out: Dict[str, list] = {name: [] for name in ("base",) + FACETS}
+        base = out["base"]
+        base.append(Vehicle.status == "available")
+        if self.q:
+            base.append(or_(
+                _in(Vehicle.make_id, _matching(db, Make, self.q)),
+                _in(Vehicle.model_id, _matching(db, Model, self.q)),
+                _in(Vehicle.location_id, _matching(db, Location, self.q)),
+            ))
+        if self.model:
+            base.append(_in(Vehicle.model_id, _matching(db, Model, self.model)))
+        if self.year_min is not None:
+            base.append(Vehicle.year >= self.year_min)
+        if self.year_max is not None:
+            base.append(Vehicle.year <= self.year_max)
+        if self.start and self.end:
+            base.append(availability.available_clause(Vehicle.id, self.start, self.end))
+        if self.make:
+            out["make"].append(_in(Vehicle.make_id, _matching(db, Make, self.make)))
+        if self.make_ids:
+            out["make"].append(Vehicle.make_id.in_(list(self.make_ids)))
+        if self.location:
+            out["location"].append(_in(Vehicle.location_id, _matching(db, Location, self.location)))
+        if self.location_ids:
+            out["location"].append(Vehicle.location_id.in_(list(self.location_ids)))
+        if self.transmission:
+            out["transmission"].append(Vehicle.transmission == self.transmission)
+        if self.seats_min is not None:
+            out["seats"].append(Vehicle.seats.is_(None) | (Vehicle.seats >= self.seats_min))
+        if self.min_price is not None:
+            out["price"].append(Vehicle.price_per_day_cents >= self.min_price)
+        if self.max_price is not None:
+            out["price"].append(Vehicle.price_per_day_cents <= self.max_price)
+        return out
+
+
+def _matching(db: Session, table, term: str) -> List[int]:
+    """Ids of dimension rows whose key contains the normalized ``term``."""
+    key = normalize_term(term).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return list(db.execute(select(table.id).where(table.key.like(f"%{key}%", escape="\\"))).scalars())
+
+
+def _in(col, ids: List[int]):
+    return col.in_(ids) if ids else false()
+
+
+def _counted(kind, search: VehicleSearch, load):
+    if settings.CARRENTAL_SEARCH_COUNTS_TTL_SECS <= 0:
+        return load()
+    return _counts.get_or_load((kind, search.cache_key()), load)
+
+
+def _flatten(clauses: Dict[str, list], without: Optional[str] = None) -> list:
+    return [c for name, cs in clauses.items() if name != without for c in cs]
+
+
+# -- pages -----------------------------------------------------------------------
+
+
+@dataclass
+class Page:
+    vehicles: List[Vehicle]
+    next_cursor: Optional[str]
+    total: Optional[int] = None
+
+
+def _cursor(sort: str, direction: str, v: Vehicle) -> str:
+    # The direction is part of the sort: a cursor only resumes the order it came from
+    return encode_cursor(f"{sort}:{direction}", getattr(v, SORTS[sort].key), v.id)
+
+
+def _cursor_value(sort: str):
+    if sort == "created":
+        return dt.datetime.fromisoformat
+
+    def price(v):
+        if not isinstance(v, int):
+            raise ValueError("bad value")
+        return v
+
+    return price
+
+
+def page(
+    db: Session,
+    search: VehicleSearch,
+    *,
+    sort: str = "created",
+    direction: str = "desc",
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+    with_total: bool = True,
+) -> Page:
+    """One page of matching vehicles in ``(sort, id)`` order; ``offset`` is only honoured without a cursor."""
+    col = SORTS[sort]
+    where = _flatten(search.clauses(db))
+    filters = list(where)
+    if cursor:
+        value, vid = decode_cursor(cursor, f"{sort}:{direction}", _cursor_value(sort))
+        after = tuple_(col, Vehicle.id) > tuple_(value, vid) if direction == "asc" else tuple_(col, Vehicle.id) < tuple_(value, vid)
+        filters.append(after)
+        offset = 0
+    order = (col.asc(), Vehicle.id.asc()) if direction == "asc" else (col.desc(), Vehicle.id.desc())
+    rows = list(db.execute(select(Vehicle).where(*filters).order_by(*order).limit(limit + 1).offset(offset)).scalars())
+    next_cursor = _cursor(sort, direction, rows[limit - 1]) if len(rows) > limit else None
+    total = None
+    if with_total:
+        total = _counted("total", search, lambda: db.execute(select(func.count()).select_from(Vehicle).where(*where)).scalar() or 0)
+    return Page(rows[:limit], next_cursor, total)
+
+
+# -- facets ----------------------------------------------------------------------
+
+
+def _price_band():
+    return case(*((Vehicle.price_per_day_cents < hi, lo) for lo, hi in zip(PRICE_BANDS, PRICE_BANDS[1:])), else_=PRICE_BANDS[-1])
+
+
+def _raw_facets(db: Session, clauses: Dict[str, list], names: Sequence[str]) -> Dict[str, Dict]:
+    """``{facet: {value: count}}``; facets with no filter of their own share one GROUPING SETS scan."""
+    cols = {"make": Vehicle.make_id, "location": Vehicle.location_id, "transmission": Vehicle.transmission, "seats": Vehicle.seats, "price": _price_band()}
+    raw: Dict[str, Dict] = {name: {} for name in names}
+    shared = [n for n in names if not clauses[n]]
+    groups = ([shared] if shared else []) + [[n] for n in names if clauses[n]]
+    for group in groups:
+        without = group[0] if clauses[group[0]] else None
+        sub = select(*(cols[n].label(n) for n in group)).where(*_flatten(clauses, without=without)).subquery()
+        keys = [sub.c[n] for n in group]
+        stmt = select(*keys, *(func.grouping(k) for k in keys), func.count()).group_by(func.grouping_sets(*(tuple_(k) for k in keys)))
+        for row in db.execute(stmt):
+            values, grouped, count = row[:len(keys)], row[len(keys):-1], row[-1]
+            for name, value, g in zip(group, values, grouped):
+                if g == 0 and value is not None:
+                    raw[name][value] = count
+    return raw
+
+
+def facet_counts(db: Session, search: VehicleSearch, names: Sequence[str] = FACETS) -> Dict[str, List[dict]]:
+    """Vehicle counts per facet value (top FACET_LIMIT for make/location), each ignoring its own filter.
+
+    Counts are reused for CARRENTAL_SEARCH_COUNTS_TTL_SECS per filter set.
+    """
+    return _counted(("facets", tuple(names)), search, lambda: _facet_counts(db, search, names))
+
+
+def _facet_counts(db: Session, search: VehicleSearch, names: Sequence[str]) -> Dict[str, List[dict]]:
+    raw = _raw_facets(db, search.clauses(db), names)
+    out: Dict[str, List[dict]] = {}
+    for name in names:
+        counts = raw[name]
+        if name in ("make", "location"):
+            dim = Make if name == "make" else Location
+            top = sorted(counts.items(), key=lambda kv: -kv[1])[:FACET_LIMIT]
+            labels = dict(db.execute(select(dim.id, dim.name).where(dim.id.in_([i for i, _ in top]))).all()) if top else {}
+            top.sort(key=lambda kv: (-kv[1], labels.get(kv[0], "")))
+            out[name] = [{"value": str(i), "label": labels.get(i), "count": c} for i, c in top]
+        elif name in ("transmission", "seats"):
+            out[name] = [{"value": str(v), "label": None, "count": c} for v, c in sorted(counts.items())]
+        elif name == "price":
+            upper = dict(zip(PRICE_BANDS, PRICE_BANDS[1:]))
+            out[name] = [
+                {"value": f"{lo}-{upper.get(lo, '')}", "label": None, "count": c, "min_cents": lo, "max_cents": upper.get(lo)}
+                for lo, c in sorted(counts.items())
+            ]
+    return out
+
+
+# -- maintenance -----------------------------------------------------------------
+
+_NORM = "btrim(regexp_replace({col}, '\\s+', ' ', 'g'))"
+
+
+def backfill_dimensions(db: Session) -> int:
+    """Give vehicles written before the dimension tables (or by bulk inserts) their make/model/location ids."""
+    make, model, loc = _NORM.format(col="make"), _NORM.format(col="model"), _NORM.format(col="location")
+    statements = (
+        f"INSERT INTO carrental_makes (key, name) SELECT lower({make}), min({make}) FROM carrental_vehicles"
+        f" WHERE make_id IS NULL AND {make} <> '' GROUP BY 1 ON CONFLICT (key) DO NOTHING",
+        f"UPDATE carrental_vehicles v SET make_id = d.id FROM carrental_makes d WHERE v.make_id IS NULL AND d.key = lower({make})",
+        f"INSERT INTO carrental_models (make_id, key, name) SELECT make_id, lower({model}), min({model}) FROM carrental_vehicles"
+        f" WHERE model_id IS NULL AND make_id IS NOT NULL AND {model} <> '' GROUP BY 1, 2 ON CONFLICT (make_id, key) DO NOTHING",
+        f"UPDATE carrental_vehicles v SET model_id = d.id FROM carrental_models d"
+        f" WHERE v.model_id IS NULL AND d.make_id = v.make_id AND d.key = lower({model})",
+        f"INSERT INTO carrental_locations (key, name) SELECT lower({loc}), min({loc}) FROM carrental_vehicles"
+        f" WHERE location_id IS NULL AND {loc} <> '' GROUP BY 1 ON CONFLICT (key) DO NOTHING",
+        f"UPDATE carrental_vehicles v SET location_id = d.id FROM carrental_locations d WHERE v.location_id IS NULL AND d.key = lower({loc})",
+    )
+    updated = 0
+    for i, sql in enumerate(statements):
+        res = db.execute(text(sql))
+        if i % 2:
+            updated += res.rowcount or 0
+    db.commit()
+    return updated
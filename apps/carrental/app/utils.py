@@ -3,6 +3,7 @@ import logging
 from typing import Any, Dict
 
 import redis
+from superapp_shared.redis_pool import get_redis
 
 from .config import settings
 
@@ -11,10 +12,8 @@ log = logging.getLogger(__name__)
 
 
 def _redis_client() -> redis.Redis | None:
-    try:
-        return redis.from_url(settings.REDIS_URL) if settings.REDIS_URL else None
-    except Exception:
-        return None
+    # Pooled client shared across publishes (one pool per URL per process)
+    return get_redis(settings.REDIS_URL)
 
 
 def notify(event: str, payload: Dict[str, Any]) -> None:
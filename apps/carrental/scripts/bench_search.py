@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Benchmark vehicle browse/search (app.search).
+
+Usage:
+  DB_URL=postgresql+psycopg2://... python apps/carrental/scripts/bench_search.py \
+      [--vehicles 500000] [--bookings 4] [--repeat 20] [--depth 500] [--skip-seed]
+
+Seeds ``--vehicles`` vehicles spread over a few hundred companies, makes,
+models and locations, each with a booking history (``--bookings`` per
+vehicle on average over the past and next six months: confirmed and held
+bookings with their day rows, canceled and expired ones without), then:
+
+* fills the make/model/location ids with ``search.backfill_dimensions``
+  (bulk-inserted rows skip the ORM hook, as a migration of old rows would);
+* times the first page (with total), page ``--depth`` and the facet counts
+  for a handful of filter mixes, with and without a date window, against
+  the previous ``ILIKE`` + ``OFFSET`` browse query; counts are timed both
+  freshly computed and reused from the counts cache;
+* checks that both return the same totals, and that walking every page of
+  one location by cursor returns each vehicle exactly once.
+
+Seeded rows are left in place; use a scratch database (``--skip-seed``
+re-runs the timings on it).
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+from sqlalchemy import func, insert, or_, select, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs", "superapp_shared"))
+
+if not os.getenv("DB_URL"):
+    print("Set DB_URL env to point to a scratch carrental database", file=sys.stderr)
+    sys.exit(2)
+
+from app import availability, search  # type: ignore  # noqa: E402
+from app.config import settings  # type: ignore  # noqa: E402
+from app.database import SessionLocal, engine  # type: ignore  # noqa: E402
+from app import main as _service  # type: ignore  # noqa: E402,F401  (creates the schema, columns and indexes as the service does)
+from app.models import Booking, Company, User, Vehicle, VehicleDay  # type: ignore  # noqa: E402
+
+MAKES = {
+    "Toyota": ["Corolla", "Camry", "Yaris", "RAV4", "Land Cruiser", "Hilux"], "Hyundai": ["Elantra", "Accent", "Tucson", "Santa Fe", "Sonata"],
+    "Kia": ["Rio", "Cerato", "Sportage", "Sorento", "Picanto"], "Nissan": ["Sunny", "Altima", "X-Trail", "Patrol"],
+    "Renault": ["Logan", "Duster", "Megane", "Symbol"], "Peugeot": ["208", "301", "3008", "508"], "Chevrolet": ["Aveo", "Cruze", "Captiva", "Tahoe"],
+    "Mercedes-Benz": ["C 200", "E 300", "S 500", "Vito"], "BMW": ["320i", "520i", "X5"], "Mitsubishi": ["Lancer", "Pajero", "L200"],
+    "Honda": ["Civic", "Accord", "CR-V"], "Volkswagen": ["Golf", "Passat", "Tiguan"], "Skoda": ["Octavia", "Superb"], "Ford": ["Focus", "Ranger", "Explorer"],
+    "Chery": ["Tiggo 7", "Arrizo 5"], "Geely": ["Emgrand", "Coolray"], "Mazda": ["Mazda3", "CX-5"], "Suzuki": ["Swift", "Vitara"], "Daewoo": ["Lanos", "Nubira"],
+    "Saipa": ["Tiba", "Saina"],
+}
+CITIES = ["Damascus", "Aleppo", "Homs", "Hama", "Latakia", "Tartus", "Deir ez-Zor", "Raqqa", "Idlib", "Daraa", "As-Suwayda", "Quneitra", "Hasakah", "Qamishli"]
+DISTRICTS = ["Airport", "Downtown", "North", "South", "East", "West"]
+TODAY = dt.date.today()
+
+
+def _seed(rnd: random.Random, n_vehicles: int, bookings_per_vehicle: float, n_companies: int = 400) -> None:
+    now = dt.datetime.utcnow()
+    locations = [f"{c} {d}" for c in CITIES for d in DISTRICTS]
+    makes = list(MAKES)
+    with engine.begin() as conn:
+        renter = uuid.uuid4()
+        users = [{"id": renter, "phone": f"bench-{renter.hex[:20]}", "role": "renter", "created_at": now}]
+        companies = []
+        for i in range(n_companies):
+            uid, cid = uuid.uuid4(), uuid.uuid4()
+            users.append({"id": uid, "phone": f"bench-{uid.hex[:20]}", "role": "seller", "created_at": now})
+            companies.append({"id": cid, "owner_user_id": uid, "name": f"Bench {i}", "location": rnd.choice(locations), "created_at": now})
+        conn.execute(insert(User.__table__), users)
+        conn.execute(insert(Company.__table__), companies)
+        for start in range(0, n_vehicles, 10000):
+            vehicles, bookings, days = [], [], []
+            for i in range(start, min(n_vehicles, start + 10000)):
+                vid = uuid.uuid4()
+                make = rnd.choice(makes)
+                # Inconsistent spelling, as sellers type it
+                shown = rnd.choice((make, make.upper(), make.lower(), f" {make}"))
+                vehicles.append({
+                    "id": vid, "company_id": rnd.choice(companies)["id"], "make": shown, "model": rnd.choice(MAKES[make]),
+                    "year": rnd.randint(2005, 2024), "transmission": rnd.choice(("auto", "auto", "manual")), "seats": rnd.choice((2, 4, 5, 5, 5, 7, 8)),
+                    "location": rnd.choice(locations), "price_per_day_cents": rnd.randrange(5000, 150000, 500),
+                    "status": "available" if rnd.random() < 0.95 else "unavailable", "created_at": now - dt.timedelta(seconds=n_vehicles - i),
+                })
+                day = TODAY - dt.timedelta(days=rnd.randint(150, 210))
+                for _ in range(int(rnd.expovariate(1 / bookings_per_vehicle)) if bookings_per_vehicle else 0):
+                    day += dt.timedelta(days=rnd.randint(0, 40))
+                    length = rnd.randint(1, 7)
+                    end = day + dt.timedelta(days=length)
+                    if end > TODAY + dt.timedelta(days=180):
+                        break
+                    status = rnd.choices(("confirmed", "requested", "canceled", "expired"), (60, 5, 25, 10))[0]
+                    if status == "requested" and end <= TODAY:
+                        status = "expired"
+                    hold = now + dt.timedelta(minutes=15) if status == "requested" else None
+                    bid = uuid.uuid4()
+                    bookings.append({
+                        "id": bid, "user_id": renter, "vehicle_id": vid, "start_date": day.isoformat(), "end_date": end.isoformat(), "days": length,
+                        "total_cents": length * 10000, "status": status, "hold_expires_at": hold, "created_at": now,
+                    })
+                    if status in ("confirmed", "requested"):
+                        days += [{"vehicle_id": vid, "day": d, "booking_id": bid, "hold_expires_at": hold} for d in availability.rental_days(day, end)]
+                    day = end
+            conn.execute(insert(Vehicle.__table__), vehicles)
+            if bookings:
+                conn.execute(insert(Booking.__table__), bookings)
+            if days:
+                conn.execute(insert(VehicleDay.__table__), days)
+
+
+def _legacy(db, s: search.VehicleSearch, offset: int, limit: int = 20):
+    """The browse query before the dimensions: ILIKE filters, a count, and OFFSET paging."""
+    query = db.query(Vehicle).filter(Vehicle.status == "available")
+    if s.q:
+        like = f"%{s.q}%"
+        query = query.filter(or_(Vehicle.make.ilike(like), Vehicle.model.ilike(like), Vehicle.location.ilike(like)))
+    if s.location:
+        query = query.filter(Vehicle.location.ilike(f"%{s.location}%"))
+    if s.make:
+        query = query.filter(Vehicle.make.ilike(f"%{s.make}%"))
+    if s.transmission:
+        query = query.filter(Vehicle.transmission == s.transmission)
+    if s.seats_min is not None:
+        query = query.filter(Vehicle.seats.is_(None) | (Vehicle.seats >= s.seats_min))
+    if s.min_price is not None:
+        query = query.filter(Vehicle.price_per_day_cents >= s.min_price)
+    if s.max_price is not None:
+        query = query.filter(Vehicle.price_per_day_cents <= s.max_price)
+    if s.start and s.end:
+        query = query.filter(availability.available_clause(Vehicle.id, s.start, s.end))
+    total = query.count()
+    rows = query.order_by(Vehicle.price_per_day_cents.asc()).limit(limit).offset(offset).all()
+    return total, rows
+
+
+def _ms(fn, repeat: int):
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(out)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--vehicles", type=int, default=500_000)
+    ap.add_argument("--bookings", type=float, default=4.0, help="average bookings per vehicle")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--depth", type=int, default=500, help="page number for the deep-page timings")
+    ap.add_argument("--skip-seed", action="store_true", help="reuse the rows of a previous run")
+    args = ap.parse_args()
+
+    rnd = random.Random(47)
+    t0 = time.perf_counter()
+    if not args.skip_seed:
+        _seed(rnd, args.vehicles, args.bookings)
+    with engine.begin() as conn:
+        counts = [conn.execute(select(func.count()).select_from(t)).scalar() for t in (Vehicle.__table__, Booking.__table__, VehicleDay.__table__)]
+    print(f"seeded  : {counts[0]:,} vehicles, {counts[1]:,} bookings, {counts[2]:,} day rows in {time.perf_counter() - t0:.1f}s", flush=True)
+
+    with SessionLocal() as db:
+        t0 = time.perf_counter()
+        n = search.backfill_dimensions(db)
+        print(f"backfill: {n:,} dimension ids in {time.perf_counter() - t0:.1f}s", flush=True)
+    with engine.begin() as conn:
+        for t in ("carrental_vehicles", "carrental_bookings", "carrental_vehicle_days", "carrental_makes", "carrental_models", "carrental_locations"):
+            conn.execute(text(f"ANALYZE {t}"))
+
+    week = (TODAY + dt.timedelta(days=14), TODAY + dt.timedelta(days=21))
+    cases = [
+        ("all", search.VehicleSearch()),
+        ("city", search.VehicleSearch(location="aleppo")),
+        ("make+district", search.VehicleSearch(make="toyota", location="damascus airport")),
+        ("q text", search.VehicleSearch(q="cruiser")),
+        ("price+attrs", search.VehicleSearch(min_price=20000, max_price=40000, transmission="auto", seats_min=5)),
+    ]
+    deep = f"p{args.depth}"
+    print(
+        f"{'case':<22}{'legacy p1':>11}{'new p1':>9}{'cached':>9}{'legacy ' + deep:>13}{'new ' + deep:>10}"
+        f"{'facets':>9}{'cached':>9}{'total':>10}  (medians; cached = counts reused)"
+    )
+    with SessionLocal() as db:
+        for dated in (False, True):
+            for name, s in cases:
+                if dated:
+                    s.start, s.end = week
+                    name += " +dates"
+                legacy_total, _ = _legacy(db, s, 0)
+                first = search.page(db, s, sort="price", direction="asc")
+                assert first.total == legacy_total, (name, first.total, legacy_total)
+                # Cursor for the deep page: walk there once, then time the fetch alone
+                cursor, depth = first.next_cursor, 1
+                while cursor and depth < args.depth - 1:
+                    cursor = search.page(db, s, sort="price", direction="asc", cursor=cursor, with_total=False).next_cursor
+                    depth += 1
+                deep_offset = (args.depth - 1) * 20
+                t_legacy1 = _ms(lambda: _legacy(db, s, 0), args.repeat)
+                t_legacy_deep = _ms(lambda: _legacy(db, s, deep_offset), args.repeat)
+                t_new_deep = f"{_ms(lambda: search.page(db, s, sort='price', direction='asc', cursor=cursor, with_total=False), args.repeat):.1f}ms" if cursor else "-"
+                settings.CARRENTAL_SEARCH_COUNTS_TTL_SECS = 0
+                t_new1 = _ms(lambda: search.page(db, s, sort="price", direction="asc"), args.repeat)
+                t_facets = _ms(lambda: search.facet_counts(db, s), max(1, args.repeat // 4))
+                settings.CARRENTAL_SEARCH_COUNTS_TTL_SECS = 30
+                t_new1_cached = _ms(lambda: search.page(db, s, sort="price", direction="asc"), args.repeat)
+                t_facets_cached = _ms(lambda: search.facet_counts(db, s), args.repeat)
+                db.expunge_all()
+                print(
+                    f"{name:<22}{t_legacy1:>9.1f}ms{t_new1:>7.1f}ms{t_new1_cached:>7.1f}ms{t_legacy_deep:>11.1f}ms{t_new_deep:>10}"
+                    f"{t_facets:>7.1f}ms{t_facets_cached:>7.1f}ms{first.total:>10,}",
+                    flush=True,
+                )
+
+        # Every vehicle of one location exactly once across all cursor pages
+        s = search.VehicleSearch(location="homs north")
+        seen, cursor, pages = [], None, 0
+        t0 = time.perf_counter()
+        while True:
+            p = search.page(db, s, sort="created", direction="desc", cursor=cursor, limit=100, with_total=cursor is None)
+            total = p.total if cursor is None else total
+            seen += [v.id for v in p.vehicles]
+            pages += 1
+            db.expunge_all()
+            cursor = p.next_cursor
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen)) == total, (len(seen), len(set(seen)), total)
+        print(f"walk    : {total:,} vehicles of one district in {pages} pages, {(time.perf_counter() - t0) / pages * 1000:.1f} ms per page, none repeated or missed")
+
+
+if __name__ == "__main__":
+    main()
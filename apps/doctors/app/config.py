@@ -21,8 +21,24 @@ class Settings:
     PAYMENTS_BASE_URL: str = os.getenv("PAYMENTS_BASE_URL", "http://host.docker.internal:8080")
     PAYMENTS_INTERNAL_SECRET: str = os.getenv("PAYMENTS_INTERNAL_SECRET", "dev_secret")
     PAYMENTS_WEBHOOK_SECRET: str = os.getenv("PAYMENTS_WEBHOOK_SECRET", "")
+    # Inbound Payments webhooks: PAYMENTS_WEBHOOK_SECRET may list "current,previous" during rotation;
+    # failed handlers are retried every WEBHOOK_RETRY_SWEEP_SECS and dead-lettered after WEBHOOK_MAX_ATTEMPTS
+    WEBHOOK_TOLERANCE_SECS: int = int(os.getenv("WEBHOOK_TOLERANCE_SECS", "300"))
+    WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+    WEBHOOK_RETRY_SWEEP_SECS: int = int(os.getenv("WEBHOOK_RETRY_SWEEP_SECS", "30"))
     PLATFORM_FEE_BPS: int = int(os.getenv("PLATFORM_FEE_BPS", "0"))
     FEE_WALLET_PHONE: str = os.getenv("FEE_WALLET_PHONE", "+963999999999")
+    PAYMENTS_TIMEOUT_SECS: float = float(os.getenv("PAYMENTS_TIMEOUT_SECS", "5"))
+    # Payment requests for bookings are retried every PAYMENT_SAGA_SWEEP_SECS; after PAYMENT_SAGA_MAX_ATTEMPTS the slot is released
+    PAYMENT_SAGA_MAX_ATTEMPTS: int = int(os.getenv("PAYMENT_SAGA_MAX_ATTEMPTS", "8"))
+    PAYMENT_SAGA_SWEEP_SECS: int = int(os.getenv("PAYMENT_SAGA_SWEEP_SECS", "15"))
+    # Scheduling: paid slots are held this long for payment (0 = until canceled); the sweeper frees lapsed holds
+    DOCTORS_HOLD_MINUTES: int = int(os.getenv("DOCTORS_HOLD_MINUTES", "15"))
+    DOCTORS_HOLD_SWEEP_SECS: int = int(os.getenv("DOCTORS_HOLD_SWEEP_SECS", "60"))
+    SCHEDULER_PARTITIONS: int = int(os.getenv("SCHEDULER_PARTITIONS", "1"))
+    # Directory: each doctor's first free slot within this horizon ranks listings; the sweeper moves it on as slots start
+    DOCTORS_NEXT_SLOT_HORIZON_DAYS: int = int(os.getenv("DOCTORS_NEXT_SLOT_HORIZON_DAYS", "30"))
+    DOCTORS_NEXT_SLOT_SWEEP_SECS: int = int(os.getenv("DOCTORS_NEXT_SLOT_SWEEP_SECS", "300"))
     # Rate limiting
     RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
     RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
@@ -0,0 +1,241 @@
+"""Doctor directory: filtered, ranked and paged listings in one query per page.
+
+Everything a listing shows or is ranked by lives on the profile row, kept up
+to date on write instead of being computed per doctor on read:
+
+- ``rating_count`` / ``rating_sum`` / ``rating_avg``: bumped in the same
+  transaction as each review.
+- ``search_vector``: name, clinic, specialty and city as a ``simple``
+  tsvector (GIN indexed), rebuilt when the profile or the doctor's name
+  changes. ``q`` matches word prefixes, all words required.
+- ``next_slot_at``: the first free slot (stored or from a template) in the
+  next ``DOCTORS_NEXT_SLOT_HORIZON_DAYS``, recomputed before the commit of
+  anything that adds, claims or frees slots (see ``scheduling.SLOTS_CHANGED``).
+  Time passing is handled by ``refresh_due`` (the ``doctors_next_slot_refresh``
+  job), so a slot that has started may still be shown for up to
+  ``DOCTORS_NEXT_SLOT_SWEEP_SECS``.
+
+Pages are keyset paged on (sort key, id), so walking every page returns each
+matching doctor exactly once.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Float, and_, bindparam, cast, event, func, inspect, or_, select, text, true, tuple_, update
+from sqlalchemy.orm import Session
+
+from superapp_shared.listing import decode_cursor, encode_cursor, prefix_tsquery
+
+from . import scheduling
+from .config import settings
+from .database import SessionLocal
+from .models import AvailabilitySlot, AvailabilityTemplate, DoctorProfile, DoctorReview, User
+from .schemas import DoctorOut
+
+SORTS = ("next_available", "rating")
+_PENDING = "doctor_directory_pending"
+
+
+def doctor_out(p: DoctorProfile, name: Optional[str]) -> DoctorOut:
+    return DoctorOut(
+        id=str(p.id), user_id=str(p.user_id), name=name, specialty=p.specialty, city=p.city, clinic_name=p.clinic_name,
+        rating_avg=p.rating_avg if p.rating_count else None, rating_count=p.rating_count or 0,
+        next_available_at=p.next_slot_at, address=p.address, latitude=p.latitude, longitude=p.longitude, bio=p.bio,
+    )
+
+
+def _search_vector(*parts):
+    return func.to_tsvector("simple", func.concat_ws(" ", *parts))
+
+
+# -- keyset pages ----------------------------------------------------------------
+
+
+def _cursor(sort: str, p: DoctorProfile) -> str:
+    return encode_cursor(sort, (p.rating_avg, p.rating_count) if sort == "rating" else p.next_slot_at, p.id)
+
+
+def _cursor_value(sort: str):
+    if sort == "rating":
+        return lambda v: (float(v[0]), int(v[1]))
+    return lambda v: dt.datetime.fromisoformat(v) if v is not None else None
+
+
+def _after(sort: str, value, did):
+    if sort == "rating":
+        return tuple_(DoctorProfile.rating_avg, DoctorProfile.rating_count, DoctorProfile.id) < tuple_(value[0], value[1], did)
+    # Doctors without a free slot sort last
+    if value is None:
+        return and_(DoctorProfile.next_slot_at.is_(None), DoctorProfile.id > did)
+    return or_(
+        tuple_(DoctorProfile.next_slot_at, DoctorProfile.id) > tuple_(value, did),
+        DoctorProfile.next_slot_at.is_(None),
+    )
+
+
+def page(
+    db: Session,
+    *,
+    city: Optional[str] = None,
+    specialty: Optional[str] = None,
+    q: Optional[str] = None,
+    sort: str = "next_available",
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> Tuple[List[DoctorOut], Optional[str]]:
+    """One page of the directory and the cursor of the next one; a single query however long the page."""
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    stmt = select(DoctorProfile, User.name).join(User, User.id == DoctorProfile.user_id)
+    if city:
+        stmt = stmt.where(DoctorProfile.city == city)
+    if specialty:
+        stmt = stmt.where(DoctorProfile.specialty == specialty)
+    tsq = prefix_tsquery(q)
+    if tsq is not None:
+        stmt = stmt.where(DoctorProfile.search_vector.op("@@")(tsq))
+    if cursor:
+        stmt = stmt.where(_after(sort, *decode_cursor(cursor, sort, _cursor_value(sort))))
+    if sort == "rating":
+        stmt = stmt.order_by(DoctorProfile.rating_avg.desc(), DoctorProfile.rating_count.desc(), DoctorProfile.id.desc())
+    else:
+        stmt = stmt.order_by(DoctorProfile.next_slot_at.asc().nulls_last(), DoctorProfile.id.asc())
+    rows = db.execute(stmt.offset(offset).limit(limit + 1)).all()
+    next_cursor = _cursor(sort, rows[limit - 1][0]) if len(rows) > limit else None
+    return [doctor_out(p, name) for p, name in rows[:limit]], next_cursor
+
+
+# -- maintenance -----------------------------------------------------------------
+
+
+def refresh_next_slots(db: Session, doctor_ids: Iterable, now: Optional[dt.datetime] = None) -> int:
+    """Recompute ``next_slot_at`` for these doctors (row locks, two slot queries for all of them, one batched update).
+
+    The profile rows are locked first, in id order: a concurrent refresh of
+    the same doctor waits for this transaction's commit and then reads a
+    calendar that includes its slot changes, instead of overwriting this
+    result with one computed from an older calendar.
+    """
+    ids = sorted({uuid.UUID(str(d)) for d in doctor_ids})
+    if not ids:
+        return 0
+    db.execute(select(DoctorProfile.id).where(DoctorProfile.id.in_(ids)).order_by(DoctorProfile.id).with_for_update())
+    now = now or dt.datetime.utcnow()
+    horizon = now + dt.timedelta(days=settings.DOCTORS_NEXT_SLOT_HORIZON_DAYS)
+    found = scheduling.calendars(db, ids, now, horizon, now=now, only_free=True)
+    t = DoctorProfile.__table__
+    db.execute(
+        update(t).where(t.c.id == bindparam("b_id")).values(next_slot_at=bindparam("b_next")),
+        [{"b_id": uuid.UUID(k), "b_next": slots[0].start_time if slots else None} for k, slots in found.items()],
+    )
+    return len(ids)
+
+
+def refresh_due(db: Session, now: Optional[dt.datetime] = None, batch: int = 500, where=None) -> int:
+    """Refresh doctors whose next slot has started, or who have none but may have one now; returns how many."""
+    now = now or dt.datetime.utcnow()
+    may_have_slots = or_(
+        select(AvailabilitySlot.id).where(
+            AvailabilitySlot.doctor_id == DoctorProfile.id, AvailabilitySlot.start_time >= now, AvailabilitySlot.is_booked == False,  # noqa: E712
+        ).exists(),
+        select(AvailabilityTemplate.id).where(AvailabilityTemplate.doctor_id == DoctorProfile.id, AvailabilityTemplate.active == True).exists(),  # noqa: E712
+    )
+    stale = or_(DoctorProfile.next_slot_at <= now, and_(DoctorProfile.next_slot_at.is_(None), may_have_slots))
+    total, last = 0, None
+    while True:
+        stmt = select(DoctorProfile.id).where(stale, where if where is not None else true())
+        if last is not None:
+            stmt = stmt.where(DoctorProfile.id > last)
+        ids = db.execute(stmt.order_by(DoctorProfile.id).limit(batch)).scalars().all()
+        if ids:
+            total += refresh_next_slots(db, ids, now=now)
+            last = ids[-1]
+        db.commit()
+        if len(ids) < batch:
+            return total
+
+
+def _refresh_search(db: Session, doctor_ids=(), user_ids=()) -> None:
+    p, u = DoctorProfile.__table__, User.__table__
+    which = []
+    if doctor_ids:
+        which.append(p.c.id.in_(list(doctor_ids)))
+    if user_ids:
+        which.append(p.c.user_id.in_(list(user_ids)))
+    db.execute(
+        update(p)
+        .where(p.c.user_id == u.c.id, or_(*which))
+        .values(search_vector=_search_vector(u.c.name, p.c.clinic_name, p.c.specialty, p.c.city))
+    )
+
+
+def _apply_ratings(db: Session, deltas: Dict[uuid.UUID, Tuple[int, int]]) -> None:
+    t = DoctorProfile.__table__
+    count, total = t.c.rating_count + bindparam("b_n"), t.c.rating_sum + bindparam("b_sum")
+    db.execute(
+        update(t).where(t.c.id == bindparam("b_id")).values(
+            rating_count=count, rating_sum=total,
+            rating_avg=func.coalesce(cast(total, Float) / func.nullif(count, 0), 0),
+        ),
+        [{"b_id": did, "b_n": n, "b_sum": s} for did, (n, s) in deltas.items()],
+    )
+
+
+def backfill(db: Session) -> None:
+    """Fill the directory columns of doctors (and reviews) written before them, then refresh stale next slots."""
+    db.execute(text(
+        "UPDATE doctor_profiles p SET search_vector = to_tsvector('simple', concat_ws(' ', u.name, p.clinic_name, p.specialty, p.city))"
+        " FROM users u WHERE u.id = p.user_id AND p.search_vector IS NULL"
+    ))
+    db.execute(text(
+        "UPDATE doctor_profiles p SET rating_count = r.n, rating_sum = r.total, rating_avg = r.total::float / r.n"
+        " FROM (SELECT doctor_id, count(*) AS n, sum(rating) AS total FROM doctor_reviews GROUP BY doctor_id) r"
+        " WHERE r.doctor_id = p.id AND (p.rating_count <> r.n OR p.rating_sum <> r.total)"
+    ))
+    db.commit()
+    refresh_due(db)
+
+
+# -- session hooks -----------------------------------------------------------------
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault(_PENDING, {"doctors": set(), "users": set(), "ratings": {}})
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, DoctorReview):
+            sign = -1 if obj in session.deleted else 1
+            n, total = pending["ratings"].get(obj.doctor_id, (0, 0))
+            pending["ratings"][obj.doctor_id] = (n + sign, total + sign * (obj.rating or 0))
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, DoctorProfile):
+            pending["doctors"].add(obj.id)
+        elif isinstance(obj, User) and obj not in session.new and inspect(obj).attrs.name.history.has_changes():
+            pending["users"].add(obj.id)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (AvailabilitySlot, AvailabilityTemplate)):
+            scheduling.slots_changed(session, [obj.doctor_id])
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _apply_changes(session):
+    session.flush()
+    pending = session.info.pop(_PENDING, None)
+    changed = session.info.pop(scheduling.SLOTS_CHANGED, None)
+    if pending:
+        if pending["ratings"]:
+            _apply_ratings(session, pending["ratings"])
+        if pending["doctors"] or pending["users"]:
+            _refresh_search(session, pending["doctors"], pending["users"])
+    if changed:
+        refresh_next_slots(session, changed)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_changes(session):
+    session.info.pop(_PENDING, None)
+    session.info.pop(scheduling.SLOTS_CHANGED, None)
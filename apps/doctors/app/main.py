@@ -11,7 +11,7 @@ except Exception:
 from sqlalchemy import text
 
 from .config import settings
-from .database import engine
+from .database import engine, SessionLocal
 from .models import Base
 from .middleware_request_id import RequestIDMiddleware
 from .middleware_rate_limit import SlidingWindowLimiter
@@ -25,6 +25,62 @@ from .routers import favorites as favorites_router
 from .routers import webhooks as webhooks_router
 from .routers import payments_webhook as payments_webhook_router
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, sql_partition_clause, store_from_env
+
+
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler running the hold sweeper (unpaid slot claims past hold_expires_at are freed), webhook retries, payment handoffs and next-slot refreshes."""
+    from .directory import refresh_due
+    from .models import AvailabilitySlot, DoctorProfile
+    from .scheduling import expire_holds
+
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="doctors", **kw)
+
+    def _expire(ctx):
+        with SessionLocal() as db:
+            return {"expired": expire_holds(db, where=sql_partition_clause(AvailabilitySlot.id, ctx))}
+
+    secs = settings.DOCTORS_HOLD_SWEEP_SECS
+    sched.add_job(
+        "doctors_hold_expiry", _expire, IntervalTrigger(max(secs, 1)),
+        partitions=settings.SCHEDULER_PARTITIONS, lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+
+    def _webhooks(ctx):
+        from .routers.payments_webhook import inbox
+
+        out = inbox.process_due()
+        out["gc_deleted"] = inbox.gc()
+        return out
+
+    # One partition: claims skip rows another replica holds, so the whole backlog is shared safely
+    secs = settings.WEBHOOK_RETRY_SWEEP_SECS
+    sched.add_job(
+        "doctors_webhook_retry", _webhooks, IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+
+    def _payment_sagas(ctx):
+        from .payment_saga import saga
+
+        return saga.process_due()
+
+    secs = settings.PAYMENT_SAGA_SWEEP_SECS
+    sched.add_job(
+        "doctors_payment_saga", _payment_sagas, IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+
+    def _next_slots(ctx):
+        with SessionLocal() as db:
+            return {"refreshed": refresh_due(db, where=sql_partition_clause(DoctorProfile.id, ctx))}
+
+    secs = settings.DOCTORS_NEXT_SLOT_SWEEP_SECS
+    sched.add_job(
+        "doctors_next_slot_refresh", _next_slots, IntervalTrigger(max(secs, 1)),
+        partitions=settings.SCHEDULER_PARTITIONS, lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    return sched
 
 
 def create_app() -> FastAPI:
@@ -70,6 +126,29 @@ def create_app() -> FastAPI:
 
     if settings.AUTO_CREATE_SCHEMA:
         Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE availability_slots ADD COLUMN IF NOT EXISTS template_id UUID REFERENCES availability_templates(id)")
+            conn.exec_driver_sql("ALTER TABLE availability_slots ADD COLUMN IF NOT EXISTS appointment_id UUID")
+            conn.exec_driver_sql("ALTER TABLE availability_slots ADD COLUMN IF NOT EXISTS hold_expires_at TIMESTAMP")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_availability_slots_doctor_start ON availability_slots (doctor_id, start_time)")
+            conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS uq_availability_slots_template_start ON availability_slots (template_id, start_time)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_availability_slots_hold ON availability_slots (hold_expires_at)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_appointments_slot ON appointments (slot_id)")
+            conn.exec_driver_sql("ALTER TABLE doctor_profiles ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0")
+            conn.exec_driver_sql("ALTER TABLE doctor_profiles ADD COLUMN IF NOT EXISTS rating_sum INTEGER NOT NULL DEFAULT 0")
+            conn.exec_driver_sql("ALTER TABLE doctor_profiles ADD COLUMN IF NOT EXISTS rating_avg DOUBLE PRECISION NOT NULL DEFAULT 0")
+            conn.exec_driver_sql("ALTER TABLE doctor_profiles ADD COLUMN IF NOT EXISTS next_slot_at TIMESTAMP")
+            conn.exec_driver_sql("ALTER TABLE doctor_profiles ADD COLUMN IF NOT EXISTS search_vector TSVECTOR")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_doctor_profiles_next ON doctor_profiles (next_slot_at, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_doctor_profiles_specialty_next ON doctor_profiles (specialty, next_slot_at, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_doctor_profiles_city_specialty_next ON doctor_profiles (city, specialty, next_slot_at, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_doctor_profiles_rating ON doctor_profiles (rating_avg, rating_count, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_doctor_profiles_city_specialty_rating ON doctor_profiles (city, specialty, rating_avg, rating_count, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_doctor_profiles_search ON doctor_profiles USING gin (search_vector)")
+        # Profiles and reviews from before the directory columns get their ratings, search terms and next slot
+        from .directory import backfill
+        with SessionLocal() as db:
+            backfill(db)
 
     @app.get("/health")
     def health():
@@ -111,6 +190,12 @@ def create_app() -> FastAPI:
     app.include_router(favorites_router.router)
     app.include_router(webhooks_router.router)
     app.include_router(payments_webhook_router.router)
+
+    if (
+        settings.DOCTORS_HOLD_SWEEP_SECS > 0 or settings.WEBHOOK_RETRY_SWEEP_SECS > 0 or settings.PAYMENT_SAGA_SWEEP_SECS > 0
+        or settings.DOCTORS_NEXT_SLOT_SWEEP_SECS > 0
+    ):
+        install_scheduler(app, build_scheduler())
     return app
 
 
@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, ForeignKey, DateTime as SaDateTime, UniqueConstraint
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Integer, Float, Date, DateTime, Boolean, ForeignKey, DateTime as SaDateTime, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from sqlalchemy.orm import declarative_base, relationship
 
 
@@ -27,6 +27,15 @@ class User(Base):
 
 class DoctorProfile(Base):
     __tablename__ = "doctor_profiles"
+    __table_args__ = (
+        # Directory listings: filter by city/specialty, rank by next free slot or rating (see directory.py)
+        Index("ix_doctor_profiles_next", "next_slot_at", "id"),
+        Index("ix_doctor_profiles_specialty_next", "specialty", "next_slot_at", "id"),
+        Index("ix_doctor_profiles_city_specialty_next", "city", "specialty", "next_slot_at", "id"),
+        Index("ix_doctor_profiles_rating", "rating_avg", "rating_count", "id"),
+        Index("ix_doctor_profiles_city_specialty_rating", "city", "specialty", "rating_avg", "rating_count", "id"),
+        Index("ix_doctor_profiles_search", "search_vector", postgresql_using="gin"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, unique=True)
@@ -37,6 +46,12 @@ class DoctorProfile(Base):
     latitude = Column(String(32), nullable=True)
     longitude = Column(String(32), nullable=True)
     bio = Column(String(1024), nullable=True)
+    # Maintained by directory.py: review totals, the first free slot within the horizon, and name/clinic/specialty/city terms
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_avg = Column(Float, nullable=False, default=0, server_default="0")
+    next_slot_at = Column(DateTime, nullable=True)
+    search_vector = Column(TSVECTOR, nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     user = relationship("User", back_populates="doctor_profile")
@@ -54,8 +69,33 @@ class DoctorImage(Base):
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 
+class AvailabilityTemplate(Base):
+    """Weekly recurring availability; its slots are expanded on read and stored only when booked."""
+
+    __tablename__ = "availability_templates"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    doctor_id = Column(UUID(as_uuid=True), ForeignKey("doctor_profiles.id"), nullable=False, index=True)
+    weekday = Column(Integer, nullable=False)  # 0=Monday .. 6=Sunday, in tz
+    start_minute = Column(Integer, nullable=False)  # minutes after local midnight
+    end_minute = Column(Integer, nullable=False)
+    slot_minutes = Column(Integer, nullable=False, default=30)
+    price_cents = Column(Integer, nullable=False, default=0)
+    tz = Column(String(64), nullable=False, default="Asia/Damascus")
+    valid_from = Column(Date, nullable=True)
+    valid_until = Column(Date, nullable=True)  # inclusive
+    active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
 class AvailabilitySlot(Base):
     __tablename__ = "availability_slots"
+    __table_args__ = (
+        Index("ix_availability_slots_doctor_start", "doctor_id", "start_time"),
+        # A template occurrence is materialized at most once
+        Index("uq_availability_slots_template_start", "template_id", "start_time", unique=True),
+        Index("ix_availability_slots_hold", "hold_expires_at"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     doctor_id = Column(UUID(as_uuid=True), ForeignKey("doctor_profiles.id"), nullable=False)
@@ -63,6 +103,10 @@ class AvailabilitySlot(Base):
     end_time = Column(SaDateTime, nullable=False)
     is_booked = Column(Boolean, nullable=False, default=False)
     price_cents = Column(Integer, nullable=False, default=0)
+    template_id = Column(UUID(as_uuid=True), ForeignKey("availability_templates.id"), nullable=True)
+    # Current claimant; a claim with hold_expires_at set lapses unless payment confirms it
+    appointment_id = Column(UUID(as_uuid=True), nullable=True)
+    hold_expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     doctor = relationship("DoctorProfile", back_populates="slots")
@@ -70,12 +114,15 @@ class AvailabilitySlot(Base):
 
 class Appointment(Base):
     __tablename__ = "appointments"
+    __table_args__ = (
+        Index("ix_appointments_slot", "slot_id"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     patient_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     doctor_id = Column(UUID(as_uuid=True), ForeignKey("doctor_profiles.id"), nullable=False)
     slot_id = Column(UUID(as_uuid=True), ForeignKey("availability_slots.id"), nullable=False)
-    status = Column(String(16), nullable=False, default="created")  # created|confirmed|canceled|completed
+    status = Column(String(16), nullable=False, default="created")  # created|confirmed|canceled|completed|expired
     price_cents = Column(Integer, nullable=False, default=0)
     payment_request_id = Column(String(64), nullable=True)
     payment_transfer_id = Column(String(64), nullable=True)
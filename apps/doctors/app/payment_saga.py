@@ -0,0 +1,50 @@
+"""Payment handoff for paid appointments (see ``superapp_shared.payment_saga``).
+
+The saga row is written in the booking transaction, sent right after the
+commit and retried by the ``doctors_payment_saga`` job. If Payments never
+takes the request, the held slot is freed and the appointment expires, the
+same end state as a lapsed hold.
+"""
+from __future__ import annotations
+
+import uuid
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from superapp_shared.payment_saga import PaymentSaga, SagaRecord, register_prometheus_collector
+
+from . import scheduling
+from .config import settings
+from .database import SessionLocal
+from .models import Appointment
+
+saga = PaymentSaga(
+    "doctors",
+    SessionLocal,
+    base_url=lambda: settings.PAYMENTS_BASE_URL,
+    secret=lambda: settings.PAYMENTS_INTERNAL_SECRET,
+    timeout_secs=settings.PAYMENTS_TIMEOUT_SECS,
+    max_attempts=settings.PAYMENT_SAGA_MAX_ATTEMPTS,
+)
+register_prometheus_collector()
+
+
+@saga.on_requested("appointment")
+def _requested(db: Session, rec: SagaRecord):
+    # An expired claim may still be paid for (confirm re-claims a free slot); a canceled one may not
+    linked = db.execute(
+        update(Appointment).where(Appointment.id == uuid.UUID(rec.ref_id), Appointment.status != "canceled")
+        .values(payment_request_id=rec.payment_request_id).execution_options(synchronize_session=False)
+    ).rowcount
+    return bool(linked)
+
+
+@saga.on_failed("appointment")
+def _release(db: Session, rec: SagaRecord) -> None:
+    ap = db.execute(select(Appointment).where(Appointment.id == uuid.UUID(rec.ref_id)).with_for_update()).scalars().first()
+    # Canceled, confirmed or already expired: nothing is held for this payment any more
+    if ap is None or ap.status != "created":
+        return
+    scheduling.release(db, ap)
+    ap.status = "expired"
@@ -1,13 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 from ..auth import get_current_user
 from ..database import get_db
-from ..models import User, AvailabilitySlot, Appointment, DoctorProfile
+from ..models import User, Appointment, DoctorProfile
 from ..schemas import AppointmentCreateIn, AppointmentOut, AppointmentsListOut
 from ..config import settings
-import httpx
-import time, hmac, hashlib, json
+from .. import scheduling
+from ..payment_saga import saga as payment_saga
 from prometheus_client import Counter
 
 
@@ -17,48 +17,46 @@ router = APIRouter(prefix="/appointments", tags=["appointments"])
 APPTS_COUNTER = Counter("doctors_appointments_total", "Doctor appointments", ["status"]) 
 
 
+def _payments_enabled() -> bool:
+    return payment_saga.enabled
+
+
 @router.post("", response_model=AppointmentOut)
-def book(payload: AppointmentCreateIn, request: Request, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    slot = db.get(AvailabilitySlot, payload.slot_id)
-    if not slot or slot.is_booked:
+def book(payload: AppointmentCreateIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    try:
+        # Paid slots are held until payment confirms; the claim itself is a single conditional update
+        ap, slot = scheduling.claim(db, payload.slot_id, user.id, hold_paid=_payments_enabled())
+    except scheduling.SlotUnavailable:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Slot not available")
     doc = db.get(DoctorProfile, slot.doctor_id)
     if not doc:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Doctor missing")
-    # Mark slot as booked and create appointment
-    slot.is_booked = True
-    ap = Appointment(patient_user_id=user.id, doctor_id=doc.id, slot_id=slot.id, status="created", price_cents=slot.price_cents or 0)
-    db.add(ap)
-    db.flush()
-
-    # Optional Payments integration
-    try:
-        amount = ap.price_cents or 0
-        if amount > 0 and settings.PAYMENTS_BASE_URL and settings.PAYMENTS_INTERNAL_SECRET:
-            # Request money for the doctor (requester=doctor, target=patient)
-            # Accepting the request (by patient) will transfer from patient -> doctor
-            doc_user = db.get(User, doc.user_id)
-            from_phone = doc_user.phone if doc_user and doc_user.phone else settings.FEE_WALLET_PHONE
-            to_phone = user.phone
-            payload_json = {"from_phone": from_phone, "to_phone": to_phone, "amount_cents": amount}
-            from superapp_shared.internal_hmac import sign_internal_request_headers
-            headers = sign_internal_request_headers(payload_json, settings.PAYMENTS_INTERNAL_SECRET, request.headers.get("X-Request-ID", ""))
-            with httpx.Client(timeout=5.0) as client:
-                r = client.post(
-                    f"{settings.PAYMENTS_BASE_URL}/internal/requests",
-                    headers=headers,
-                    json=payload_json,
-                )
-                if r.status_code < 400:
-                    ap.payment_request_id = r.json().get("id")
-    except Exception:
-        pass
+    saga_id = None
+    if ap.price_cents and _payments_enabled():
+        # Fee request (requester=doctor, target=patient): accepting it transfers patient -> doctor.
+        # Recorded with the claim, so a Payments outage retries it instead of losing it
+        doc_user = db.get(User, doc.user_id)
+        saga_id = payment_saga.begin(
+            db, "appointment", ap.id,
+            from_phone=doc_user.phone if doc_user and doc_user.phone else settings.FEE_WALLET_PHONE,
+            to_phone=user.phone, amount_cents=ap.price_cents,
+            metadata={"appointment_id": str(ap.id), "service": "doctors"},
+        )
+    # Release the slot row lock before calling Payments
+    db.commit()
+    if saga_id:
+        payment_saga.dispatch(saga_id)
+        db.refresh(ap)
 
     try:
         APPTS_COUNTER.labels(status=ap.status).inc()
     except Exception:
         pass
-    return AppointmentOut(id=str(ap.id), doctor_id=str(ap.doctor_id), patient_user_id=str(ap.patient_user_id), slot_id=str(ap.slot_id), status=ap.status, created_at=ap.created_at, price_cents=ap.price_cents, payment_request_id=ap.payment_request_id)
+    return _out(ap)
+
+
+def _out(a: Appointment) -> AppointmentOut:
+    return AppointmentOut(id=str(a.id), doctor_id=str(a.doctor_id), patient_user_id=str(a.patient_user_id), slot_id=str(a.slot_id), status=a.status, created_at=a.created_at, price_cents=a.price_cents, payment_request_id=a.payment_request_id)
 
 
 @router.get("", response_model=AppointmentsListOut)
@@ -69,6 +67,18 @@ def my_appointments(user: User = Depends(get_current_user), db: Session = Depend
     ])
 
 
+@router.get("/{appointment_id}/payment")
+def appointment_payment(appointment_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Where the payment handoff stands: pending (being retried), requested, compensated (slot released) or canceled."""
+    ap = db.get(Appointment, appointment_id)
+    if not ap or ap.patient_user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Appointment not found")
+    rec = payment_saga.status(db, "appointment", ap.id)
+    if rec is not None:
+        return rec.to_dict()
+    return {"status": "requested" if ap.payment_request_id else "none", "payment_request_id": ap.payment_request_id, "amount_cents": ap.price_cents, "attempts": 0, "next_attempt_at": None}
+
+
 @router.post("/{appointment_id}/cancel", response_model=AppointmentOut)
 def cancel_my_appointment(appointment_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     ap = db.get(Appointment, appointment_id)
@@ -76,10 +86,12 @@ def cancel_my_appointment(appointment_id: str, user: User = Depends(get_current_
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Appointment not found")
     if ap.status in ("canceled", "completed"):
         return AppointmentOut(id=str(ap.id), doctor_id=str(ap.doctor_id), patient_user_id=str(ap.patient_user_id), slot_id=str(ap.slot_id), status=ap.status, created_at=ap.created_at, price_cents=ap.price_cents, payment_request_id=ap.payment_request_id)
+    if ap.status != "expired":
+        scheduling.release(db, ap)
+    # Not sent yet: never ask for it. Already recorded: withdraw it; still in flight: withdrawn once recorded
+    if not payment_saga.cancel(db, "appointment", ap.id):
+        payment_saga.void(db, "appointment", ap.id)
     ap.status = "canceled"
-    slot = db.get(AvailabilitySlot, ap.slot_id)
-    if slot:
-        slot.is_booked = False
     db.flush()
     try:
         if ap.payment_transfer_id and ap.price_cents > 0:
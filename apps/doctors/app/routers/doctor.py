@@ -1,10 +1,13 @@
+from datetime import datetime, time, timedelta
+
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 from ..auth import get_current_user
 from ..database import get_db
-from ..models import User, DoctorProfile, AvailabilitySlot, Appointment, DoctorImage
-from ..schemas import DoctorProfileIn, DoctorOut, SlotCreateIn, SlotOut, AppointmentsListOut, AppointmentOut, DoctorImageCreateIn, DoctorImageOut
+from ..models import User, DoctorProfile, AvailabilitySlot, AvailabilityTemplate, Appointment, DoctorImage
+from ..schemas import DoctorProfileIn, DoctorOut, SlotCreateIn, SlotOut, AppointmentsListOut, AppointmentOut, DoctorImageCreateIn, DoctorImageOut, TemplateIn, TemplateOut, CalendarOut, CalendarSlotOut
+from .. import scheduling
 
 
 router = APIRouter(prefix="/doctor", tags=["doctor"])
@@ -54,6 +57,80 @@ def my_slots(user: User = Depends(get_current_user), db: Session = Depends(get_d
     return [SlotOut(id=str(s.id), doctor_id=str(s.doctor_id), start_time=s.start_time, end_time=s.end_time, is_booked=s.is_booked, price_cents=s.price_cents) for s in slots]
 
 
+def _minute(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+def _template_out(t: AvailabilityTemplate) -> TemplateOut:
+    def _t(m: int) -> time:
+        return time(0) if m >= 24 * 60 else time(m // 60, m % 60)
+
+    return TemplateOut(id=str(t.id), doctor_id=str(t.doctor_id), weekday=t.weekday, start_time=_t(t.start_minute), end_time=_t(t.end_minute), slot_minutes=t.slot_minutes, price_cents=t.price_cents, tz=t.tz, valid_from=t.valid_from, valid_until=t.valid_until, active=t.active)
+
+
+def calendar_out(db: Session, doctor_id, from_time: datetime | None, to_time: datetime | None, only_free: bool = False) -> CalendarOut:
+    """Calendar window, defaulting to the next 7 days; 400 when over ``scheduling.MAX_WINDOW_DAYS``."""
+    start = from_time or datetime.utcnow().replace(second=0, microsecond=0)
+    end = to_time or start + timedelta(days=7)
+    try:
+        scheduling.check_window(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    slots = scheduling.calendars(db, [doctor_id], start, end, only_free=only_free)[str(doctor_id)]
+    return CalendarOut(doctor_id=str(doctor_id), slots=[
+        CalendarSlotOut(slot_id=c.slot_id, start_time=c.start_time, end_time=c.end_time, price_cents=c.price_cents, state=c.state, template_id=c.template_id)
+        for c in slots
+    ])
+
+
+@router.post("/templates", response_model=TemplateOut)
+def add_template(payload: TemplateIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    prof = db.query(DoctorProfile).filter(DoctorProfile.user_id == user.id).one_or_none()
+    if prof is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Create profile first")
+    end_minute = _minute(payload.end_time) or 24 * 60  # 00:00 ends at midnight
+    t = AvailabilityTemplate(
+        doctor_id=prof.id, weekday=payload.weekday, start_minute=_minute(payload.start_time), end_minute=end_minute,
+        slot_minutes=payload.slot_minutes, price_cents=payload.price_cents, tz=payload.tz,
+        valid_from=payload.valid_from, valid_until=payload.valid_until, active=True,
+    )
+    try:
+        scheduling.validate_template(t)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    db.add(t)
+    db.flush()
+    return _template_out(t)
+
+
+@router.get("/templates", response_model=list[TemplateOut])
+def my_templates(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    prof = db.query(DoctorProfile).filter(DoctorProfile.user_id == user.id).one_or_none()
+    if prof is None:
+        return []
+    rows = db.query(AvailabilityTemplate).filter(AvailabilityTemplate.doctor_id == prof.id, AvailabilityTemplate.active == True).order_by(AvailabilityTemplate.weekday, AvailabilityTemplate.start_minute).all()  # noqa: E712
+    return [_template_out(t) for t in rows]
+
+
+@router.delete("/templates/{template_id}")
+def delete_template(template_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Stop offering the template's future slots; appointments already booked from it stay."""
+    prof = db.query(DoctorProfile).filter(DoctorProfile.user_id == user.id).one_or_none()
+    t = db.get(AvailabilityTemplate, template_id)
+    if not t or not prof or t.doctor_id != prof.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    t.active = False
+    return {"detail": "ok"}
+
+
+@router.get("/calendar", response_model=CalendarOut)
+def my_calendar(from_time: datetime | None = None, to_time: datetime | None = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    prof = db.query(DoctorProfile).filter(DoctorProfile.user_id == user.id).one_or_none()
+    if prof is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Create profile first")
+    return calendar_out(db, prof.id, from_time, to_time)
+
+
 @router.get("/appointments", response_model=AppointmentsListOut)
 def my_appointments(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     prof = db.query(DoctorProfile).filter(DoctorProfile.user_id == user.id).one_or_none()
@@ -75,11 +152,14 @@ def update_appointment_status(appointment_id: str, status_value: str, user: User
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Appointment not found")
     if status_value not in ("confirmed", "canceled", "completed"):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid status")
+    if status_value == "canceled" and ap.status not in ("canceled", "expired"):
+        scheduling.release(db, ap)
+    elif status_value == "confirmed" and ap.status in ("created", "expired"):
+        # Confirming by hand makes the claim firm, like a payment would
+        if not scheduling.confirm(db, ap):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Slot no longer available")
     ap.status = status_value
     if status_value == "canceled":
-        slot = db.get(AvailabilitySlot, ap.slot_id)
-        if slot:
-            slot.is_booked = False
         try:
             if ap.payment_transfer_id and ap.price_cents > 0:
                 from ..utils.webhooks import send_webhooks
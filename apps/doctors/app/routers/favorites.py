@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from ..auth import get_current_user
 from ..database import get_db
 from ..models import FavoriteDoctor, DoctorProfile, User
 from ..schemas import DoctorOut
+from .. import directory
 
 
 router = APIRouter(prefix="/doctors", tags=["favorites"])
@@ -38,14 +40,11 @@ def unfavorite_doctor(doctor_id: str, user: User = Depends(get_current_user), db
 
 @router.get("/favorites", response_model=list[DoctorOut])
 def list_favorites(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    favs = db.query(FavoriteDoctor).filter(FavoriteDoctor.user_id == user.id).all()
-    ids = [f.doctor_id for f in favs]
-    if not ids:
-        return []
-    docs = db.query(DoctorProfile).filter(DoctorProfile.id.in_(ids)).all()
-    out: list[DoctorOut] = []
-    for d in docs:
-        u = db.get(User, d.user_id)
-        out.append(DoctorOut(id=str(d.id), user_id=str(d.user_id), name=u.name if u else None, specialty=d.specialty, city=d.city, clinic_name=d.clinic_name))
-    return out
-
+    rows = db.execute(
+        select(DoctorProfile, User.name)
+        .join(FavoriteDoctor, FavoriteDoctor.doctor_id == DoctorProfile.id)
+        .join(User, User.id == DoctorProfile.user_id)
+        .where(FavoriteDoctor.user_id == user.id)
+        .order_by(FavoriteDoctor.created_at.desc())
+    ).all()
+    return [directory.doctor_out(p, name) for p, name in rows]
@@ -1,64 +1,65 @@
-import hmac
-import hashlib
-import json
-from fastapi import APIRouter, Header, HTTPException, status, Depends
-from sqlalchemy.orm import Session
+import logging
+from fastapi import APIRouter, BackgroundTasks, Request
+
+from superapp_shared.webhook_inbox import InboundEvent, WebhookInbox, parse_secrets, register_prometheus_collector, webhook_inbox_store_from_env
 
 from ..config import settings
-from ..database import get_db
+from ..database import SessionLocal, engine
 from ..models import Appointment
+from .. import scheduling
 
+log = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/payments", tags=["payments-webhook"])
 
+# Signature over the raw body, replay window and event-id dedupe; handlers run after the ack
+inbox = WebhookInbox(
+    "doctors",
+    webhook_inbox_store_from_env(engine),
+    secrets=lambda: parse_secrets(settings.PAYMENTS_WEBHOOK_SECRET),
+    tolerance_secs=settings.WEBHOOK_TOLERANCE_SECS,
+    max_attempts=settings.WEBHOOK_MAX_ATTEMPTS,
+)
+register_prometheus_collector()
+
+
+@inbox.on("requests.accept", "requests.accepted")
+def _request_accepted(ev: InboundEvent) -> None:
+    pr_id = ev.data.get("id")
+    transfer_id = ev.data.get("transfer_id")
+    if not pr_id:
+        return
+    with SessionLocal() as db:
+        # In tests/dev, multiple appointments may reuse the same PR id.
+        # Pick the most recent one.
+        ap = (
+            db.query(Appointment)
+            .filter(Appointment.payment_request_id == pr_id)
+            .order_by(Appointment.created_at.desc())
+            .first()
+        )
+        if ap is not None and ap.status in ("created", "expired"):
+            if not scheduling.confirm(db, ap):
+                # Paid after the hold lapsed and the slot went to someone else; refund path
+                log.warning("appointment %s paid after hold expiry; slot taken", ap.id)
+            if transfer_id:
+                ap.payment_transfer_id = transfer_id
+            db.commit()
+
 
-def _verify(ts: str, event: str, body: bytes, sign: str) -> bool:
-    secret = getattr(settings, "PAYMENTS_WEBHOOK_SECRET", None)
-    if not secret:
-        return False
-    expect = hmac.new(secret.encode("utf-8"), (ts + event).encode("utf-8") + body, hashlib.sha256).hexdigest()
-    try:
-        return hmac.compare_digest(expect, sign)
-    except Exception:
-        return False
+@inbox.on("refunds.create")
+def _refunded(ev: InboundEvent) -> None:
+    original = ev.data.get("original")
+    if not original:
+        return
+    with SessionLocal() as db:
+        apps = db.query(Appointment).filter(Appointment.payment_transfer_id == original).all()
+        for ap in apps:
+            ap.refund_status = "completed"
+        if apps:
+            db.commit()
 
 
 @router.post("/webhooks")
-def receive_webhook(
-    payload: dict,
-    db: Session = Depends(get_db),
-    ts: str | None = Header(default=None, alias="X-Webhook-Ts"),
-    event: str | None = Header(default=None, alias="X-Webhook-Event"),
-    sign: str | None = Header(default=None, alias="X-Webhook-Sign"),
-):
-    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
-    if not ts or not event or not sign or not _verify(ts, event, raw, sign):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid signature")
-    if payload.get("type") in ("requests.accept", "requests.accepted"):
-        data = payload.get("data", {})
-        pr_id = data.get("id")
-        transfer_id = data.get("transfer_id")
-        if pr_id:
-            # In tests/dev, multiple appointments may reuse the same PR id.
-            # Pick the most recent one.
-            ap = (
-                db.query(Appointment)
-                .filter(Appointment.payment_request_id == pr_id)
-                .order_by(Appointment.created_at.desc())
-                .first()
-            )
-            if ap is not None and ap.status != "confirmed":
-                ap.status = "confirmed"
-                if transfer_id:
-                    ap.payment_transfer_id = transfer_id
-                db.flush()
-    elif payload.get("type") in ("refunds.create",):
-        data = payload.get("data", {})
-        original = data.get("original")
-        if original:
-            apps = db.query(Appointment).filter(Appointment.payment_transfer_id == original).all()
-            for ap in apps:
-                ap.refund_status = "completed"
-            if apps:
-                db.flush()
-    return {"detail": "ok"}
+async def receive_webhook(request: Request, background: BackgroundTasks):
+    return await inbox.receive_request(request, background)
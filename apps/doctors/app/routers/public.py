@@ -1,70 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from superapp_shared.listing import set_next_link
+
 from ..database import get_db
-from ..models import User, DoctorProfile, AvailabilitySlot, DoctorReview
-from ..schemas import DoctorOut, SearchSlotsIn, SearchSlotsOut, SearchSlotOut
+from ..models import User, DoctorProfile
+from ..schemas import DoctorOut, SearchSlotsIn, SearchSlotsOut, SearchSlotOut, CalendarOut
+from .. import directory, scheduling
+from .doctor import calendar_out
 
 
 router = APIRouter(tags=["public"])  # no auth
 
 
 @router.get("/doctors", response_model=list[DoctorOut])
-def list_doctors(city: str | None = None, specialty: str | None = None, q: str | None = None, limit: int = 50, offset: int = 0, db: Session = Depends(get_db)):
-    q = db.query(DoctorProfile)
-    if city:
-        q = q.filter(DoctorProfile.city == city)
-    if specialty:
-        q = q.filter(DoctorProfile.specialty == specialty)
-    docs = q.limit(limit).offset(offset).all()
-    res: list[DoctorOut] = []
-    for d in docs:
-        u = db.get(User, d.user_id)
-        # Aggregate ratings
-        from sqlalchemy import func
-        avg, cnt = db.query(func.avg(DoctorReview.rating), func.count(DoctorReview.id)).filter(DoctorReview.doctor_id == d.id).one()
-        # Search q over name/clinic
-        if q:
-            if ((u.name or "") + " " + (d.clinic_name or "")).lower().find(q.lower()) < 0:
-                continue
-        res.append(DoctorOut(id=str(d.id), user_id=str(d.user_id), name=u.name if u else None, specialty=d.specialty, city=d.city, clinic_name=d.clinic_name, rating_avg=float(avg) if avg is not None else None, rating_count=int(cnt) if cnt is not None else 0))
-    return res
+def list_doctors(
+    request: Request,
+    response: Response,
+    city: str | None = None,
+    specialty: str | None = None,
+    q: str | None = None,
+    sort: str = "next_available",
+    cursor: str | None = None,
+    limit: int = Query(50, gt=0, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    """Directory page ranked by next free slot (or ``sort=rating``); the next page is linked in the ``Link`` header."""
+    try:
+        docs, next_cursor = directory.page(db, city=city, specialty=specialty, q=q, sort=sort, cursor=cursor, limit=limit, offset=offset)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    set_next_link(request, response, next_cursor, limit)
+    return docs
 
 
 @router.get("/doctors/{doctor_id}", response_model=DoctorOut)
 def get_doctor(doctor_id: str, db: Session = Depends(get_db)):
+    row = db.execute(
+        select(DoctorProfile, User.name).join(User, User.id == DoctorProfile.user_id).where(DoctorProfile.id == doctor_id)
+    ).first()
+    if not row:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor not found")
+    return directory.doctor_out(*row)
+
+
+@router.get("/doctors/{doctor_id}/calendar", response_model=CalendarOut)
+def doctor_calendar(doctor_id: str, from_time: datetime | None = None, to_time: datetime | None = None, only_free: bool = True, db: Session = Depends(get_db)):
     d = db.get(DoctorProfile, doctor_id)
     if not d:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor not found")
-    u = db.get(User, d.user_id)
-    from sqlalchemy import func
-    avg, cnt = db.query(func.avg(DoctorReview.rating), func.count(DoctorReview.id)).filter(DoctorReview.doctor_id == d.id).one()
-    return DoctorOut(id=str(d.id), user_id=str(d.user_id), name=u.name if u else None, specialty=d.specialty, city=d.city, clinic_name=d.clinic_name, rating_avg=float(avg) if avg is not None else None, rating_count=int(cnt) if cnt is not None else 0)
+    return calendar_out(db, d.id, from_time, to_time, only_free=only_free)
 
 
 @router.post("/search_slots", response_model=SearchSlotsOut)
 def search_slots(payload: SearchSlotsIn, db: Session = Depends(get_db)):
-    # Find free slots meeting criteria
-    q = db.query(AvailabilitySlot).filter(AvailabilitySlot.is_booked == False)  # noqa: E712
+    # Free slots meeting criteria, stored and expanded from templates
+    try:
+        scheduling.check_window(payload.start_time, payload.end_time)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    filters = []
     if payload.doctor_id:
-        q = q.filter(AvailabilitySlot.doctor_id == payload.doctor_id)
-    if payload.start_time:
-        q = q.filter(AvailabilitySlot.start_time >= payload.start_time)
-    if payload.end_time:
-        q = q.filter(AvailabilitySlot.end_time <= payload.end_time)
-    slots = q.order_by(AvailabilitySlot.start_time.asc()).limit(payload.limit).offset(payload.offset).all()
-    out: list[SearchSlotOut] = []
-    for s in slots:
-        d = db.get(DoctorProfile, s.doctor_id)
-        if not d:
-            continue
-        if payload.city and d.city != payload.city:
-            continue
-        if payload.specialty and d.specialty != payload.specialty:
-            continue
-        u = db.get(User, d.user_id)
-        out.append(SearchSlotOut(
-            doctor_id=str(d.id), doctor_name=(u.name if u else None), specialty=d.specialty, city=d.city,
-            slot_id=str(s.id), start_time=s.start_time, end_time=s.end_time,
-        ))
-    return SearchSlotsOut(slots=out)
+        filters.append(DoctorProfile.id == payload.doctor_id)
+    if payload.city:
+        filters.append(DoctorProfile.city == payload.city)
+    if payload.specialty:
+        filters.append(DoctorProfile.specialty == payload.specialty)
+    found = scheduling.free_slots(db, payload.start_time, payload.end_time, filters, limit=payload.limit, offset=payload.offset)
+    names = dict(db.query(User.id, User.name).filter(User.id.in_({d.user_id for _, d in found})).all()) if found else {}
+    return SearchSlotsOut(slots=[
+        SearchSlotOut(
+            doctor_id=str(d.id), doctor_name=names.get(d.user_id), specialty=d.specialty, city=d.city,
+            slot_id=c.slot_id, start_time=c.start_time, end_time=c.end_time,
+        )
+        for c, d in found
+    ])
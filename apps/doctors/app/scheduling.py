@@ -0,0 +1,347 @@
+"""Appointment scheduling: slot claims, payment holds and recurring availability.
+
+Slots come from two places. Explicit ``availability_slots`` rows are added by
+the doctor one at a time. ``availability_templates`` describe weekly hours
+("Mondays 09:00-13:00 in 30 minute slots") and are expanded on read; an
+occurrence gets a slot row only when someone books it. Expanded slots carry
+the id ``tpl_<template>_<YYYYMMDDTHHMM>`` (UTC start), which ``claim``
+accepts like a row id.
+
+A claim is one conditional UPDATE on the slot row: it succeeds only if the
+slot is free or its hold has lapsed, so concurrent patients get exactly one
+winner. The slot records the claiming appointment. Paid slots are held for
+``DOCTORS_HOLD_MINUTES``; ``confirm`` (payment accepted) clears the hold,
+and ``expire_holds`` (the ``doctors_hold_expiry`` job) frees lapsed ones. A
+lapsed hold is also taken over by the next claim, expiring the appointment
+that held it.
+
+Claims, releases and expiries are bulk UPDATEs the session does not track,
+so they record the doctors whose free slots changed in
+``session.info[SLOTS_CHANGED]``; the directory refreshes their next free
+slot before the commit.
+
+All times are naive UTC, like the rest of the service; templates are
+interpreted in their own ``tz``.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import and_, or_, select, true, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Appointment, AvailabilitySlot, AvailabilityTemplate, DoctorProfile
+
+TEMPLATE_SLOT_PREFIX = "tpl_"
+MAX_WINDOW_DAYS = 62
+SLOTS_CHANGED = "doctor_slots_changed"
+_UTC = dt.timezone.utc
+
+
+class SlotUnavailable(Exception):
+    """The slot does not exist, is not bookable, or someone else holds it."""
+
+
+def slots_changed(db: Session, doctor_ids: Iterable) -> None:
+    db.info.setdefault(SLOTS_CHANGED, set()).update(doctor_ids)
+
+
+# -- template expansion ----------------------------------------------------------
+
+
+def template_slot_id(template_id, start: dt.datetime) -> str:
+    return f"{TEMPLATE_SLOT_PREFIX}{uuid.UUID(str(template_id)).hex}_{start:%Y%m%dT%H%M}"
+
+
+def parse_template_slot_id(slot_id: str) -> Optional[Tuple[uuid.UUID, dt.datetime]]:
+    if not slot_id.startswith(TEMPLATE_SLOT_PREFIX):
+        return None
+    try:
+        tid, stamp = slot_id[len(TEMPLATE_SLOT_PREFIX):].split("_", 1)
+        return uuid.UUID(tid), dt.datetime.strptime(stamp, "%Y%m%dT%H%M")
+    except ValueError:
+        return None
+
+
+def validate_template(t: AvailabilityTemplate) -> None:
+    """``ValueError`` unless the template describes at least one whole slot."""
+    if not 0 <= t.weekday <= 6:
+        raise ValueError("weekday must be 0..6")
+    if not (0 <= t.start_minute < t.end_minute <= 24 * 60):
+        raise ValueError("Invalid time range")
+    if not t.slot_minutes or t.slot_minutes < 5 or t.end_minute - t.start_minute < t.slot_minutes:
+        raise ValueError("slot_minutes must be >= 5 and fit the range")
+    if t.valid_from and t.valid_until and t.valid_until < t.valid_from:
+        raise ValueError("valid_until before valid_from")
+    try:
+        ZoneInfo(t.tz)
+    except Exception:
+        raise ValueError("Unknown tz")
+
+
+def expand(t: AvailabilityTemplate, start: dt.datetime, end: dt.datetime) -> Iterator[Tuple[dt.datetime, dt.datetime]]:
+    """UTC (start, end) of the template's occurrences starting in ``[start, end)``."""
+    tz = ZoneInfo(t.tz)
+    day = start.replace(tzinfo=_UTC).astimezone(tz).date() - dt.timedelta(days=1)
+    last = end.replace(tzinfo=_UTC).astimezone(tz).date()
+    day += dt.timedelta(days=(t.weekday - day.weekday()) % 7)
+    step = dt.timedelta(minutes=t.slot_minutes)
+    while day <= last:
+        if (t.valid_from is None or day >= t.valid_from) and (t.valid_until is None or day <= t.valid_until):
+            midnight = dt.datetime.combine(day, dt.time(0), tzinfo=tz)
+            for m in range(t.start_minute, t.end_minute - t.slot_minutes + 1, t.slot_minutes):
+                # Wall-clock arithmetic in the template's zone, then to naive UTC
+                local = (midnight.replace(tzinfo=None) + dt.timedelta(minutes=m)).replace(tzinfo=tz)
+                s = local.astimezone(_UTC).replace(tzinfo=None)
+                if start <= s < end:
+                    yield s, s + step
+        day += dt.timedelta(days=7)
+
+
+# -- claims ------------------------------------------------------------------------
+
+
+def _free_or_lapsed(now: dt.datetime):
+    return or_(
+        AvailabilitySlot.is_booked == False,  # noqa: E712
+        and_(AvailabilitySlot.hold_expires_at.isnot(None), AvailabilitySlot.hold_expires_at <= now),
+    )
+
+
+def _overlaps_explicit(db: Session, doctor_id, start: dt.datetime, end: dt.datetime) -> bool:
+    return db.execute(
+        select(AvailabilitySlot.id).where(
+            AvailabilitySlot.doctor_id == doctor_id, AvailabilitySlot.template_id.is_(None),
+            AvailabilitySlot.start_time < end, AvailabilitySlot.end_time > start,
+        ).limit(1)
+    ).first() is not None
+
+
+def materialize(db: Session, template_id, start: dt.datetime, now: Optional[dt.datetime] = None) -> uuid.UUID:
+    """Row id for a template occurrence, inserting the row on first use; ``SlotUnavailable`` if not an occurrence."""
+    now = now or dt.datetime.utcnow()
+    t = db.get(AvailabilityTemplate, template_id)
+    if t is None or not t.active or start <= now:
+        raise SlotUnavailable()
+    occ = next(iter(expand(t, start, start + dt.timedelta(minutes=1))), None)
+    if occ is None or occ[0] != start or _overlaps_explicit(db, t.doctor_id, *occ):
+        raise SlotUnavailable()
+    db.execute(
+        pg_insert(AvailabilitySlot.__table__)
+        .values(id=uuid.uuid4(), doctor_id=t.doctor_id, template_id=t.id, start_time=occ[0], end_time=occ[1],
+                is_booked=False, price_cents=t.price_cents, created_at=now)
+        .on_conflict_do_nothing(index_elements=["template_id", "start_time"])
+    )
+    return db.execute(
+        select(AvailabilitySlot.id).where(AvailabilitySlot.template_id == t.id, AvailabilitySlot.start_time == occ[0])
+    ).scalar_one()
+
+
+def resolve_slot_id(db: Session, slot_id: str, now: Optional[dt.datetime] = None) -> uuid.UUID:
+    parsed = parse_template_slot_id(slot_id)
+    if parsed is not None:
+        return materialize(db, *parsed, now=now)
+    try:
+        return uuid.UUID(slot_id)
+    except ValueError:
+        raise SlotUnavailable()
+
+
+def _take(db: Session, slot_id, appointment_id, hold_until: Optional[dt.datetime], now: dt.datetime) -> bool:
+    won = db.execute(
+        update(AvailabilitySlot)
+        .where(AvailabilitySlot.id == slot_id, _free_or_lapsed(now))
+        .values(is_booked=True, appointment_id=appointment_id, hold_expires_at=hold_until)
+        .returning(AvailabilitySlot.doctor_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if won is None:
+        return False
+    slots_changed(db, won)
+    # A lapsed holder loses the slot with its appointment
+    db.execute(
+        update(Appointment)
+        .where(Appointment.slot_id == slot_id, Appointment.status == "created", Appointment.id != appointment_id)
+        .values(status="expired")
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def claim(db: Session, slot_id: str, patient_user_id, *, hold_paid: bool, hold_minutes: Optional[int] = None, now: Optional[dt.datetime] = None) -> Tuple[Appointment, AvailabilitySlot]:
+    """Claim the slot for a new appointment, or raise ``SlotUnavailable``; the caller commits.
+
+    With ``hold_paid`` a priced slot is only held until payment: the claim lapses after ``hold_minutes``.
+    """
+    now = now or dt.datetime.utcnow()
+    sid = resolve_slot_id(db, slot_id, now)
+    price = db.execute(select(AvailabilitySlot.price_cents).where(AvailabilitySlot.id == sid)).scalar()
+    minutes = settings.DOCTORS_HOLD_MINUTES if hold_minutes is None else hold_minutes
+    hold_until = now + dt.timedelta(minutes=minutes) if hold_paid and price and minutes > 0 else None
+    ap_id = uuid.uuid4()
+    if price is None or not _take(db, sid, ap_id, hold_until, now):
+        raise SlotUnavailable()
+    slot = db.execute(select(AvailabilitySlot).where(AvailabilitySlot.id == sid).execution_options(populate_existing=True)).scalar_one()
+    ap = Appointment(id=ap_id, patient_user_id=patient_user_id, doctor_id=slot.doctor_id, slot_id=slot.id, status="created", price_cents=slot.price_cents or 0)
+    db.add(ap)
+    db.flush()
+    return ap, slot
+
+
+def confirm(db: Session, ap: Appointment, now: Optional[dt.datetime] = None) -> bool:
+    """Payment accepted: make the claim firm. Re-claims the slot if the hold lapsed and it is still free."""
+    now = now or dt.datetime.utcnow()
+    firm = db.execute(
+        update(AvailabilitySlot)
+        .where(AvailabilitySlot.id == ap.slot_id, AvailabilitySlot.appointment_id == ap.id)
+        .values(is_booked=True, hold_expires_at=None)
+        .returning(AvailabilitySlot.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if firm is None and not _take(db, ap.slot_id, ap.id, None, now):
+        return False
+    ap.status = "confirmed"
+    db.flush()
+    return True
+
+
+def release(db: Session, ap: Appointment) -> None:
+    """Free the appointment's slot if it still holds it (slots booked before claims were recorded are freed too)."""
+    db.execute(
+        update(AvailabilitySlot)
+        .where(AvailabilitySlot.id == ap.slot_id, or_(AvailabilitySlot.appointment_id == ap.id, AvailabilitySlot.appointment_id.is_(None)))
+        .values(is_booked=False, appointment_id=None, hold_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    slots_changed(db, [ap.doctor_id])
+
+
+def expire_holds(db: Session, now: Optional[dt.datetime] = None, batch: int = 500, where=None) -> int:
+    """Free slots whose payment hold lapsed and expire their appointments; returns how many."""
+    now = now or dt.datetime.utcnow()
+    total = 0
+    while True:
+        due = (
+            select(AvailabilitySlot.id)
+            .where(AvailabilitySlot.hold_expires_at <= now, where if where is not None else true())
+            .limit(batch)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        rows = db.execute(
+            update(AvailabilitySlot)
+            .where(AvailabilitySlot.id.in_(due))
+            .values(is_booked=False, appointment_id=None, hold_expires_at=None)
+            .returning(AvailabilitySlot.id, AvailabilitySlot.doctor_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if rows:
+            slots_changed(db, {doctor_id for _, doctor_id in rows})
+            db.execute(
+                update(Appointment)
+                .where(Appointment.slot_id.in_([sid for sid, _ in rows]), Appointment.status == "created")
+                .values(status="expired")
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+        total += len(rows)
+        if len(rows) < batch:
+            return total
+
+
+# -- calendar ----------------------------------------------------------------------
+
+
+@dataclass
+class CalendarSlot:
+    slot_id: str
+    doctor_id: str
+    start_time: dt.datetime
+    end_time: dt.datetime
+    price_cents: int
+    state: str  # free|held|booked
+    template_id: Optional[str] = None
+
+
+def _state(s: AvailabilitySlot, now: dt.datetime) -> str:
+    if not s.is_booked or (s.hold_expires_at is not None and s.hold_expires_at <= now):
+        return "free"
+    return "held" if s.hold_expires_at is not None else "booked"
+
+
+def check_window(start: dt.datetime, end: dt.datetime) -> None:
+    if end <= start:
+        raise ValueError("Invalid time range")
+    if end - start > dt.timedelta(days=MAX_WINDOW_DAYS):
+        raise ValueError(f"Window longer than {MAX_WINDOW_DAYS} days")
+
+
+def calendars(db: Session, doctor_ids: Sequence, start: dt.datetime, end: dt.datetime, now: Optional[dt.datetime] = None, only_free: bool = False) -> Dict[str, List[CalendarSlot]]:
+    """Slots per doctor in ``[start, end)``: stored rows (one indexed range query) plus expanded templates."""
+    now = now or dt.datetime.utcnow()
+    out: Dict[str, List[CalendarSlot]] = {str(d): [] for d in doctor_ids}
+    if not out:
+        return out
+    rows = db.execute(
+        select(AvailabilitySlot).where(
+            AvailabilitySlot.doctor_id.in_(list(doctor_ids)), AvailabilitySlot.start_time >= start, AvailabilitySlot.start_time < end,
+        )
+    ).scalars().all()
+    stored = set()
+    explicit: Dict[str, List[Tuple[dt.datetime, dt.datetime]]] = {}
+    for s in rows:
+        if s.template_id is not None:
+            stored.add((s.template_id, s.start_time))
+        else:
+            explicit.setdefault(str(s.doctor_id), []).append((s.start_time, s.end_time))
+        out[str(s.doctor_id)].append(CalendarSlot(
+            str(s.id), str(s.doctor_id), s.start_time, s.end_time, s.price_cents or 0, _state(s, now),
+            str(s.template_id) if s.template_id else None,
+        ))
+    templates = db.execute(
+        select(AvailabilityTemplate).where(AvailabilityTemplate.doctor_id.in_(list(doctor_ids)), AvailabilityTemplate.active == True)  # noqa: E712
+    ).scalars().all()
+    for t in templates:
+        busy = explicit.get(str(t.doctor_id), ())
+        for s, e in expand(t, max(start, now), end):
+            if (t.id, s) in stored or any(bs < e and be > s for bs, be in busy):
+                continue
+            out[str(t.doctor_id)].append(CalendarSlot(template_slot_id(t.id, s), str(t.doctor_id), s, e, t.price_cents or 0, "free", str(t.id)))
+    for k, slots in out.items():
+        slots.sort(key=lambda c: (c.start_time, c.slot_id))
+        if only_free:
+            out[k] = [c for c in slots if c.state == "free"]
+    return out
+
+
+def free_slots(db: Session, start: dt.datetime, end: dt.datetime, doctor_filters: Iterable = (), limit: int = 50, offset: int = 0) -> List[Tuple[CalendarSlot, DoctorProfile]]:
+    """Free slots (stored and template) across doctors matching ``doctor_filters``, by start time."""
+    now = dt.datetime.utcnow()
+    doctors = {
+        str(d.id): d
+        for d in db.execute(
+            select(DoctorProfile).where(
+                *doctor_filters,
+                or_(
+                    select(AvailabilitySlot.id).where(
+                        AvailabilitySlot.doctor_id == DoctorProfile.id, AvailabilitySlot.start_time >= start,
+                        AvailabilitySlot.start_time < end, _free_or_lapsed(now),
+                    ).exists(),
+                    select(AvailabilityTemplate.id).where(AvailabilityTemplate.doctor_id == DoctorProfile.id, AvailabilityTemplate.active == True).exists(),  # noqa: E712
+                ),
+            )
+        ).scalars()
+    }
+    found = [
+        (c, doctors[doc_id])
+        for doc_id, slots in calendars(db, list(doctors), start, end, now=now, only_free=True).items()
+        for c in slots if c.end_time <= end
+    ]
+    found.sort(key=lambda x: (x[0].start_time, x[0].slot_id))
+    return found[offset: offset + limit]
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime, time
 
 
 class TokenOut(BaseModel):
@@ -39,6 +39,7 @@ class DoctorOut(BaseModel):
     clinic_name: Optional[str] = None
     rating_avg: Optional[float] = None
     rating_count: Optional[int] = None
+    next_available_at: Optional[datetime] = None
     address: Optional[str] = None
     latitude: Optional[str] = None
     longitude: Optional[str] = None
@@ -71,6 +72,45 @@ class SlotOut(BaseModel):
     price_cents: int
 
 
+class TemplateIn(BaseModel):
+    weekday: int = Field(ge=0, le=6, description="0=Monday .. 6=Sunday")
+    start_time: time  # local wall-clock time in tz
+    end_time: time
+    slot_minutes: int = Field(30, ge=5, le=480)
+    price_cents: int = Field(0, ge=0)
+    tz: str = "Asia/Damascus"
+    valid_from: Optional[date] = None
+    valid_until: Optional[date] = None
+
+
+class TemplateOut(BaseModel):
+    id: str
+    doctor_id: str
+    weekday: int
+    start_time: time
+    end_time: time
+    slot_minutes: int
+    price_cents: int
+    tz: str
+    valid_from: Optional[date] = None
+    valid_until: Optional[date] = None
+    active: bool
+
+
+class CalendarSlotOut(BaseModel):
+    slot_id: str
+    start_time: datetime
+    end_time: datetime
+    price_cents: int
+    state: str  # free|held|booked
+    template_id: Optional[str] = None
+
+
+class CalendarOut(BaseModel):
+    doctor_id: str
+    slots: List[CalendarSlotOut]
+
+
 class SearchSlotsIn(BaseModel):
     doctor_id: Optional[str] = None
     city: Optional[str] = None
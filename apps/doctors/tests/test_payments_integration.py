@@ -4,6 +4,7 @@ import json
 import hmac
 import hashlib
 from datetime import datetime, timedelta
+import httpx
 from fastapi.testclient import TestClient
 
 # Ensure DB_URL is set (tests in this repo rely on a running Postgres)
@@ -66,16 +67,14 @@ def test_booking_creates_internal_payment_request_doctor_to_patient(monkeypatch)
     settings.PAYMENTS_BASE_URL = "http://payments.test"
     settings.PAYMENTS_INTERNAL_SECRET = "sek"
 
-    # Patch httpx.Client used in appointments module
-    from app.routers import appointments as ap_mod
-
+    # Patch httpx.Client used for the payment handoff
     fake = _FakeHttpxClient()
 
     def _mk_client(timeout=5.0):
         # Return the same fake client; captures posts
         return fake
 
-    monkeypatch.setattr(ap_mod.httpx, "Client", _mk_client)
+    monkeypatch.setattr(httpx, "Client", _mk_client)
 
     suf = int(time.time()) % 100000
     doc_phone = f"+9639050{suf:05d}"
@@ -115,7 +114,6 @@ def test_webhook_accept_confirms_appointment(monkeypatch):
     pat_phone = f"+9639053{suf:05d}"
 
     # Fake httpx client to return PR id
-    from app.routers import appointments as ap_mod
     fake = _FakeHttpxClient()
 
     def _mk_client(timeout=5.0):
@@ -123,7 +121,7 @@ def test_webhook_accept_confirms_appointment(monkeypatch):
 
     settings.PAYMENTS_BASE_URL = "http://payments.test"
     settings.PAYMENTS_INTERNAL_SECRET = "sek"
-    monkeypatch.setattr(ap_mod.httpx, "Client", _mk_client)
+    monkeypatch.setattr(httpx, "Client", _mk_client)
 
     # Create doc+slot and book
     h_doc = _auth(doc_phone, role="doctor", name="Doc")
@@ -22,6 +22,9 @@ class Settings:
     PAYMENTS_INTERNAL_SECRET: str = os.getenv("PAYMENTS_INTERNAL_SECRET", "dev_secret")
     PLATFORM_FEE_BPS: int = int(os.getenv("PLATFORM_FEE_BPS", "0"))
     FEE_WALLET_PHONE: str = os.getenv("FEE_WALLET_PHONE", "+963999999999")
+    # Payment requests for bookings are retried every PAYMENT_SAGA_SWEEP_SECS; after PAYMENT_SAGA_MAX_ATTEMPTS the seats are released
+    PAYMENT_SAGA_MAX_ATTEMPTS: int = int(os.getenv("PAYMENT_SAGA_MAX_ATTEMPTS", "8"))
+    PAYMENT_SAGA_SWEEP_SECS: int = int(os.getenv("PAYMENT_SAGA_SWEEP_SECS", "15"))
     # Rate limiting
     RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory|redis
     RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
@@ -21,6 +21,25 @@ from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_
 from .middleware_request_id import RequestIDMiddleware
 from .middleware_rate_limit import SlidingWindowLimiter
 from .middleware_rate_limit_redis import RedisRateLimiter
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, store_from_env
+
+
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler retrying payment handoffs for bookings."""
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="flights", **kw)
+
+    def _payment_sagas(ctx):
+        from .payment_saga import saga
+
+        return saga.process_due()
+
+    # One partition: claims skip rows another replica holds, so the whole backlog is shared safely
+    secs = settings.PAYMENT_SAGA_SWEEP_SECS
+    sched.add_job(
+        "flights_payment_saga", _payment_sagas, IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    return sched
 
 
 def create_app() -> FastAPI:
@@ -107,6 +126,9 @@ def create_app() -> FastAPI:
     app.include_router(flights_router.router)
     app.include_router(bookings_router.router)
     app.include_router(promos_router.router)
+
+    if settings.PAYMENT_SAGA_SWEEP_SECS > 0:
+        install_scheduler(app, build_scheduler())
     return app
 
 
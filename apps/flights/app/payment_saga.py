@@ -0,0 +1,53 @@
+"""Payment handoff for seat bookings (see ``superapp_shared.payment_saga``).
+
+The saga row is written with the seat assignment, sent right after the
+commit and retried by the ``flights_payment_saga`` job. A booking is
+confirmed once its payment request exists; if Payments never takes the
+request, the seats go back on sale and the booking is canceled.
+"""
+from __future__ import annotations
+
+import uuid
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from superapp_shared.payment_saga import PaymentSaga, SagaRecord, register_prometheus_collector
+
+from .config import settings
+from .database import SessionLocal
+from .models import Booking, Flight, FlightSeat
+
+saga = PaymentSaga(
+    "flights",
+    SessionLocal,
+    base_url=lambda: settings.PAYMENTS_BASE_URL,
+    secret=lambda: settings.PAYMENTS_INTERNAL_SECRET,
+    max_attempts=settings.PAYMENT_SAGA_MAX_ATTEMPTS,
+)
+register_prometheus_collector()
+
+
+def _locked(db: Session, rec: SagaRecord):
+    return db.execute(select(Booking).where(Booking.id == uuid.UUID(rec.ref_id)).with_for_update()).scalars().first()
+
+
+@saga.on_requested("booking")
+def _requested(db: Session, rec: SagaRecord):
+    b = _locked(db, rec)
+    if b is None or b.status == "canceled":
+        # Canceled while the request was in flight: have the saga withdraw it
+        return False
+    b.payment_request_id = rec.payment_request_id
+    if b.status == "reserved":
+        b.status = "confirmed"
+
+
+@saga.on_failed("booking")
+def _release(db: Session, rec: SagaRecord) -> None:
+    b = _locked(db, rec)
+    if b is None or b.status != "reserved":
+        return
+    db.execute(update(Flight).where(Flight.id == b.flight_id).values(seats_available=Flight.seats_available + b.seats_count))
+    db.execute(update(FlightSeat).where(FlightSeat.booking_id == b.id).values(booking_id=None))
+    b.status = "canceled"
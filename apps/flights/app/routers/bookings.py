@@ -1,13 +1,13 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-import httpx
 
 from ..auth import get_current_user, get_db
 from ..config import settings
 from sqlalchemy import func, select
 from ..models import User, Flight, Booking, Airline, FlightSeat, PromoCode, PromoRedemption
 from ..schemas import CreateBookingIn, BookingOut, BookingsListOut, CancelIn, TicketOut
+from ..payment_saga import saga as payment_saga
 
 
 router = APIRouter(prefix="/bookings", tags=["bookings"])
@@ -31,7 +31,7 @@ def _to_booking_out(db: Session, b: Booking) -> BookingOut:
 
 
 @router.post("", response_model=BookingOut)
-def create_booking(payload: CreateBookingIn, request: Request, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_booking(payload: CreateBookingIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     flight = db.get(Flight, payload.flight_id)
     if flight is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Flight not found")
@@ -100,29 +100,18 @@ def create_booking(payload: CreateBookingIn, request: Request, user: User = Depe
             pc.uses_count = (pc.uses_count or 0) + 1
             db.add(PromoRedemption(promo_code_id=pc.id, booking_id=booking.id, user_id=user.id))
 
-    payment_request_id = None
-    # Optional: create a payment request in Payments service
-    try:
-        if settings.PAYMENTS_BASE_URL and settings.PAYMENTS_INTERNAL_SECRET and total > 0:
-            to_phone = settings.FEE_WALLET_PHONE
-            payload_json = {"from_phone": user.phone, "to_phone": to_phone, "amount_cents": total}
-            from superapp_shared.internal_hmac import sign_internal_request_headers
-            headers = sign_internal_request_headers(payload_json, settings.PAYMENTS_INTERNAL_SECRET, request.headers.get("X-Request-ID", ""))
-            with httpx.Client(timeout=5.0) as client:
-                r = client.post(
-                    f"{settings.PAYMENTS_BASE_URL}/internal/requests",
-                    headers=headers,
-                    json=payload_json,
-                )
-                if r.status_code < 400:
-                    payment_request_id = r.json().get("id")
-    except Exception:
-        pass
-
-    if payment_request_id:
-        booking.payment_request_id = payment_request_id
-        booking.status = "confirmed"
-    db.flush()
+    saga_id = None
+    if total > 0 and payment_saga.enabled:
+        # Recorded with the seats, so a Payments outage retries it instead of losing it;
+        # the booking is confirmed once the request exists
+        saga_id = payment_saga.begin(
+            db, "booking", booking.id, from_phone=user.phone, to_phone=settings.FEE_WALLET_PHONE, amount_cents=total,
+            metadata={"booking_id": str(booking.id), "service": "flights"},
+        )
+    db.commit()
+    if saga_id:
+        payment_saga.dispatch(saga_id)
+        db.refresh(booking)
 
     out = _to_booking_out(db, booking)
     seats = db.query(FlightSeat).filter(FlightSeat.booking_id == booking.id).order_by(FlightSeat.seat_number.asc()).all()
@@ -184,11 +173,26 @@ def cancel_booking(booking_id: str, payload: CancelIn | None = None, user: User
     rows = db.query(FlightSeat).filter(FlightSeat.booking_id == b.id).all()
     for r in rows:
         r.booking_id = None
+    # Not sent yet: never ask for it. Already recorded: withdraw it; still in flight: withdrawn once recorded
+    if not payment_saga.cancel(db, "booking", b.id):
+        payment_saga.void(db, "booking", b.id)
     b.status = "canceled"
     db.flush()
     return {"detail": "canceled"}
 
 
+@router.get("/{booking_id}/payment")
+def booking_payment(booking_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Where the payment handoff stands: pending (being retried), requested, compensated (seats released) or canceled."""
+    b = db.get(Booking, booking_id)
+    if b is None or b.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    rec = payment_saga.status(db, "booking", b.id)
+    if rec is not None:
+        return rec.to_dict()
+    return {"status": "requested" if b.payment_request_id else "none", "payment_request_id": b.payment_request_id, "amount_cents": b.total_price_cents, "attempts": 0, "next_attempt_at": None}
+
+
 @router.get("/{booking_id}/ticket", response_model=TicketOut)
 def booking_ticket(booking_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     b = db.get(Booking, booking_id)
@@ -0,0 +1,161 @@
+import datetime as dt
+import json
+import os
+import random
+import uuid
+
+import httpx
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+os.environ.setdefault("DB_URL", os.getenv("DB_URL", "postgresql+psycopg2://postgres:postgres@pg:5432/postgres"))
+
+from app.config import settings  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import Airline, Booking, Flight, FlightSeat  # noqa: E402
+from app.payment_saga import saga  # noqa: E402
+
+
+client = TestClient(app)
+
+
+class FlakyPayments:
+    """Local stand-in for Payments ``/internal/requests`` and ``/internal/requests/cancel``.
+
+    Keeps one request per idempotency key like the real service, and fails
+    ``fail_rate`` of the calls: connection refused, 502, or the work is done
+    but the answer is lost. ``lose`` loses every create answer, ``down``
+    refuses every call, and ``settled`` is what a withdrawal finds when the
+    request was paid in the meantime.
+    """
+
+    def __init__(self, seed: int, fail_rate: float = 0.5):
+        self.rnd = random.Random(seed)
+        self.fail_rate = fail_rate
+        self.lose = False
+        self.down = False
+        self.settled = "canceled"
+        self.created: dict[str, str] = {}
+        self.canceled: set[str] = set()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        roll = self.rnd.random()
+        if self.down or roll < self.fail_rate / 3:
+            raise httpx.ConnectError("connection refused", request=request)
+        if roll < self.fail_rate * 2 / 3:
+            return httpx.Response(502)
+        if request.url.path == "/internal/requests/cancel":
+            pr_id = self.created.get(json.loads(request.content)["idempotency_key"])
+            if pr_id is not None and self.settled == "canceled":
+                self.canceled.add(pr_id)
+            answer = httpx.Response(200, json={"id": pr_id, "status": self.settled}) if pr_id else httpx.Response(404)
+        else:
+            pr_id = self.created.setdefault(request.headers["X-Idempotency-Key"], f"PR_{uuid.uuid4().hex[:12]}")
+            answer = httpx.Response(200, json={"id": pr_id})
+            if self.lose:
+                raise httpx.ReadTimeout("answer lost", request=request)
+        if roll < self.fail_rate:
+            raise httpx.ReadTimeout("answer lost", request=request)
+        return answer
+
+
+def _auth():
+    phone = f"+9639{uuid.uuid4().int % 10**8:08d}"
+    client.post("/auth/request_otp", json={"phone": phone})
+    r = client.post("/auth/verify_otp", json={"phone": phone, "otp": "123456", "name": "Flyer"})
+    assert r.status_code == 200, r.text
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _flight(seats=40):
+    with SessionLocal() as db:
+        al = Airline(name=f"Air-{uuid.uuid4().hex[:8]}")
+        db.add(al)
+        db.flush()
+        depart = dt.datetime.utcnow() + dt.timedelta(days=3)
+        f = Flight(airline_id=al.id, origin="Damascus", destination="Aleppo", depart_at=depart, price_cents=9000, seats_total=seats, seats_available=seats)
+        db.add(f)
+        db.commit()
+        return str(f.id)
+
+
+def _stub(monkeypatch, stub, max_attempts=3):
+    monkeypatch.setattr(settings, "PAYMENTS_BASE_URL", "http://payments.stub")
+    monkeypatch.setattr(settings, "PAYMENTS_INTERNAL_SECRET", "sek")
+    monkeypatch.setattr(saga, "transport", httpx.MockTransport(stub))
+    monkeypatch.setattr(saga, "retry_base_secs", 0)
+    monkeypatch.setattr(saga, "max_attempts", max_attempts)
+    return stub
+
+
+def _held(db, booking_id) -> int:
+    return len(db.execute(select(FlightSeat).where(FlightSeat.booking_id == uuid.UUID(booking_id))).scalars().all())
+
+
+def test_bookings_end_requested_or_released_through_an_outage(monkeypatch):
+    stub = _stub(monkeypatch, FlakyPayments(seed=3, fail_rate=0.7))
+    h, flight_id = _auth(), _flight()
+    booked = [client.post("/bookings", headers=h, json={"flight_id": flight_id, "seats_count": 2}).json() for _ in range(8)]
+    for _ in range(20):
+        saga.process_due()
+    outcomes = set()
+    with SessionLocal() as db:
+        held = 0
+        for b in booked:
+            rec = saga.status(db, "booking", b["id"])
+            row = db.get(Booking, uuid.UUID(b["id"]))
+            outcomes.add(rec.status)
+            if rec.status == "requested":
+                assert row.status == "confirmed" and row.payment_request_id == rec.payment_request_id
+                assert stub.created[saga.idempotency_key("booking", b["id"])] == rec.payment_request_id
+                assert _held(db, b["id"]) == 2
+                held += 2
+            else:
+                assert rec.status == "compensated" and row.status == "canceled" and _held(db, b["id"]) == 0
+                # Withdrawn at Payments first if a lost answer had created it
+                key = saga.idempotency_key("booking", b["id"])
+                assert key not in stub.created or stub.created[key] in stub.canceled
+        assert db.get(Flight, uuid.UUID(flight_id)).seats_available == 40 - held
+    assert outcomes == {"requested", "compensated"}, outcomes
+
+
+def test_unanswered_withdrawal_keeps_the_seats_until_payments_answers(monkeypatch):
+    stub = _stub(monkeypatch, FlakyPayments(seed=1, fail_rate=0))
+    stub.lose = True
+    h, flight_id = _auth(), _flight()
+    b = client.post("/bookings", headers=h, json={"flight_id": flight_id, "seats_count": 2}).json()
+    saga.process_due()
+    key = saga.idempotency_key("booking", b["id"])
+    assert key in stub.created
+    # Retries run out while Payments is unreachable: it may hold the request, so nothing is released yet
+    stub.down = True
+    saga.process_due()
+    with SessionLocal() as db:
+        rec = saga.status(db, "booking", b["id"])
+        assert rec.status == "compensating" and rec.last_error.startswith("withdraw:")
+        assert db.get(Booking, uuid.UUID(b["id"])).status == "reserved" and _held(db, b["id"]) == 2
+        assert db.get(Flight, uuid.UUID(flight_id)).seats_available == 38
+    assert client.get(f"/bookings/{b['id']}/payment", headers=h).json()["status"] == "compensating"
+    stub.down = False
+    saga.process_due()
+    with SessionLocal() as db:
+        rec = saga.status(db, "booking", b["id"])
+        assert rec.status == "compensated" and stub.created[key] in stub.canceled
+        assert db.get(Booking, uuid.UUID(b["id"])).status == "canceled" and _held(db, b["id"]) == 0
+        assert db.get(Flight, uuid.UUID(flight_id)).seats_available == 40
+
+
+def test_request_paid_before_the_withdrawal_confirms_the_booking(monkeypatch):
+    stub = _stub(monkeypatch, FlakyPayments(seed=1, fail_rate=0), max_attempts=2)
+    stub.lose, stub.settled = True, "accepted"
+    h, flight_id = _auth(), _flight()
+    b = client.post("/bookings", headers=h, json={"flight_id": flight_id, "seats_count": 1}).json()
+    saga.process_due()
+    pr_id = stub.created[saga.idempotency_key("booking", b["id"])]
+    with SessionLocal() as db:
+        rec = saga.status(db, "booking", b["id"])
+        row = db.get(Booking, uuid.UUID(b["id"]))
+        assert rec.status == "requested" and rec.payment_request_id == pr_id
+        assert row.status == "confirmed" and row.payment_request_id == pr_id and _held(db, b["id"]) == 1
+    assert not stub.canceled
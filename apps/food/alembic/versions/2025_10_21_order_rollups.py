@@ -0,0 +1,79 @@
+"""
+order reporting rollups: hourly/daily counters, latency bins, item quantities
+
+Revision ID: 20251021_rollups
+Revises: 20251020_core
+Create Date: 2025-10-21
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '20251021_rollups'
+down_revision = '20251020_core'
+branch_labels = None
+depends_on = None
+
+
+_COUNTERS = """
+            orders_total BIGINT NOT NULL DEFAULT 0,
+            orders_delivered BIGINT NOT NULL DEFAULT 0,
+            orders_canceled BIGINT NOT NULL DEFAULT 0,
+            gross_cents BIGINT NOT NULL DEFAULT 0,
+            revenue_cents BIGINT NOT NULL DEFAULT 0,
+            accepted_count BIGINT NOT NULL DEFAULT 0,
+            accepted_ms BIGINT NOT NULL DEFAULT 0,
+            prep_count BIGINT NOT NULL DEFAULT 0,
+            prep_ms BIGINT NOT NULL DEFAULT 0,
+            delivery_count BIGINT NOT NULL DEFAULT 0,
+            delivery_ms BIGINT NOT NULL DEFAULT 0,
+            total_count BIGINT NOT NULL DEFAULT 0,
+            total_ms BIGINT NOT NULL DEFAULT 0,
+"""
+
+
+def upgrade() -> None:
+    op.execute("CREATE INDEX IF NOT EXISTS ix_orders_restaurant_created ON orders (restaurant_id, created_at)")
+    for table in ("order_rollups_hourly", "order_rollups_daily"):
+        op.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket_start TIMESTAMP NOT NULL,
+                restaurant_id UUID NOT NULL REFERENCES restaurants(id),
+                {_COUNTERS}
+                PRIMARY KEY (bucket_start, restaurant_id)
+            )
+            """
+        )
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_rollup_latency_bins (
+            grain VARCHAR(1) NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            restaurant_id UUID NOT NULL REFERENCES restaurants(id),
+            metric VARCHAR(16) NOT NULL,
+            bin SMALLINT NOT NULL,
+            count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (grain, bucket_start, restaurant_id, metric, bin)
+        )
+        """
+    )
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_rollup_items_daily (
+            bucket_start TIMESTAMP NOT NULL,
+            restaurant_id UUID NOT NULL REFERENCES restaurants(id),
+            item_name VARCHAR(128) NOT NULL,
+            qty BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket_start, restaurant_id, item_name)
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS order_rollup_items_daily")
+    op.execute("DROP TABLE IF EXISTS order_rollup_latency_bins")
+    op.execute("DROP TABLE IF EXISTS order_rollups_daily")
+    op.execute("DROP TABLE IF EXISTS order_rollups_hourly")
+    op.execute("DROP INDEX IF EXISTS ix_orders_restaurant_created")
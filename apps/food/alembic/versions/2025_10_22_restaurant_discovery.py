@@ -0,0 +1,68 @@
+"""
+restaurant discovery: location cell, rating totals, search vector, parsed opening hours
+
+Revision ID: 20251022_discovery
+Revises: 20251021_rollups
+Create Date: 2025-10-22
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '20251022_discovery'
+down_revision = '20251021_rollups'
+branch_labels = None
+depends_on = None
+
+
+_COLUMNS = (
+    ("latitude", "DOUBLE PRECISION"),
+    ("longitude", "DOUBLE PRECISION"),
+    ("cell", "BIGINT"),
+    ("rating_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("rating_sum", "INTEGER NOT NULL DEFAULT 0"),
+    ("rating_avg", "DOUBLE PRECISION NOT NULL DEFAULT 0"),
+    ("search_vector", "TSVECTOR"),
+    ("has_hours", "BOOLEAN"),
+)
+
+_INDEXES = (
+    ("ix_restaurants_created", "restaurants (created_at, id)"),
+    ("ix_restaurants_city_created", "restaurants (city, created_at, id)"),
+    ("ix_restaurants_rating", "restaurants (rating_avg, rating_count, id)"),
+    ("ix_restaurants_city_rating", "restaurants (city, rating_avg, rating_count, id)"),
+    ("ix_restaurants_cell", "restaurants (cell)"),
+    ("ix_restaurants_search", "restaurants USING gin (search_vector)"),
+    ("ix_restaurant_reviews_restaurant", "restaurant_reviews (restaurant_id, created_at)"),
+    ("ix_restaurant_hours_weekly", "restaurant_hours (restaurant_id, weekday, open_minute)"),
+    ("ix_restaurant_hours_day", "restaurant_hours (day, restaurant_id)"),
+    ("ix_restaurant_hours_open", "restaurant_hours (weekday, open_minute, close_minute, restaurant_id)"),
+)
+
+
+def upgrade() -> None:
+    for name, ddl in _COLUMNS:
+        op.execute(f"ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS {name} {ddl}")
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS restaurant_hours (
+            id BIGSERIAL PRIMARY KEY,
+            restaurant_id UUID NOT NULL REFERENCES restaurants(id) ON DELETE CASCADE,
+            weekday SMALLINT NULL,
+            day DATE NULL,
+            open_minute SMALLINT NULL,
+            close_minute SMALLINT NULL
+        )
+        """
+    )
+    for name, target in _INDEXES:
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    # Existing rows get their search vector, rating totals and hours from discovery.backfill at startup
+
+
+def downgrade() -> None:
+    for name, _ in reversed(_INDEXES):
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute("DROP TABLE IF EXISTS restaurant_hours")
+    for name, _ in reversed(_COLUMNS):
+        op.execute(f"ALTER TABLE restaurants DROP COLUMN IF EXISTS {name}")
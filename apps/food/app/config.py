@@ -45,6 +45,12 @@ class Settings:
     STOCK_LOW_THRESHOLD: int = int(os.getenv("STOCK_LOW_THRESHOLD", "3"))
     # Payout taxes/fees
     TAX_RATE_BPS: int = int(os.getenv("TAX_RATE_BPS", "0"))
+    # Reporting rollups: scheduled reconcile of the trailing window (0 disables)
+    ROLLUP_RECONCILE_INTERVAL_SECS: int = int(os.getenv("ROLLUP_RECONCILE_INTERVAL_SECS", "3600"))
+    ROLLUP_RECONCILE_DAYS: int = int(os.getenv("ROLLUP_RECONCILE_DAYS", "2"))
+    # Restaurant discovery: grid cell size for "near me" (0.05 deg is ~5.5 km) and default search radius
+    FOOD_GEO_CELL_DEG: float = float(os.getenv("FOOD_GEO_CELL_DEG", "0.05"))
+    FOOD_NEAR_RADIUS_KM: float = float(os.getenv("FOOD_NEAR_RADIUS_KM", "10"))
     # Optional TOTP 2FA (applies where service enables it)
     REQUIRE_TOTP: bool = env_bool("REQUIRE_TOTP", default=False)
     # ESC/POS (best effort)
@@ -11,7 +11,7 @@ except Exception:
 from sqlalchemy import text
 
 from .config import settings
-from .database import engine
+from .database import engine, SessionLocal
 from .models import Base
 from .middleware_request_id import RequestIDMiddleware
 from .middleware_rate_limit import SlidingWindowLimiter
@@ -28,13 +28,34 @@ from .routers import reviews as reviews_router
 from .routers import favorites as favorites_router
 from .routers import operator as operator_router
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, store_from_env
+from superapp_shared.idempotency import IdempotencyMiddleware, idempotency_store_from_env, register_prometheus_collector as register_idempotency_metrics
 from .utils.webhooks import process_pending_once
+from .utils import discovery, rollups
 import threading, time
+from datetime import datetime, timedelta
 
 
 _DB_OK = True
 
 
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler running the rollup reconcile (repairs drift in the trailing ROLLUP_RECONCILE_DAYS)."""
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="food", **kw)
+
+    def _reconcile(ctx):
+        since = datetime.utcnow() - timedelta(days=max(1, settings.ROLLUP_RECONCILE_DAYS))
+        return {"corrected": rollups.reconcile(engine, since)}
+
+    # One leased run across all replicas; failures are logged by the scheduler
+    secs = settings.ROLLUP_RECONCILE_INTERVAL_SECS
+    sched.add_job(
+        "food_rollup_reconcile", _reconcile, IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    return sched
+
+
 def create_app() -> FastAPI:
     app = FastAPI(title="Food Delivery API", version="0.1.0")
 
@@ -47,6 +68,13 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
     app.add_middleware(RequestIDMiddleware)
+    # Idempotency-Key on checkout: retries replay the first order instead of charging again
+    app.add_middleware(
+        IdempotencyMiddleware,
+        store=idempotency_store_from_env(engine, settings.REDIS_URL, prefix="idem:food"),
+        service="food",
+        paths=["/orders/checkout"],
+    )
     # Trusted hosts + forwarded headers
     allowed_hosts = getattr(settings, "ALLOWED_HOSTS", None) or (["*"] if settings.ENV != "prod" else ["api.example.com"])
     app.add_middleware(TrustedHostMiddleware, allowed_hosts=allowed_hosts)
@@ -80,7 +108,7 @@ def create_app() -> FastAPI:
         Base.metadata.create_all(bind=engine)
         # Lightweight evolution for newly added columns in dev/demo
         try:
-            with engine.connect() as conn:
+            with engine.begin() as conn:
                 conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS hours_json TEXT")
                 conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS is_open_override BOOLEAN")
                 conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS special_hours_json TEXT")
@@ -100,6 +128,22 @@ def create_app() -> FastAPI:
                 conn.exec_driver_sql("ALTER TABLE menu_items ADD COLUMN IF NOT EXISTS oos_until TIMESTAMP NULL")
                 conn.exec_driver_sql("ALTER TABLE menu_items ADD COLUMN IF NOT EXISTS station VARCHAR(32)")
                 conn.exec_driver_sql("ALTER TABLE order_items ADD COLUMN IF NOT EXISTS station_snapshot VARCHAR(32)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_orders_restaurant_created ON orders (restaurant_id, created_at)")
+                conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION")
+                conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION")
+                conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS cell BIGINT")
+                conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0")
+                conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS rating_sum INTEGER NOT NULL DEFAULT 0")
+                conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS rating_avg DOUBLE PRECISION NOT NULL DEFAULT 0")
+                conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS search_vector TSVECTOR")
+                conn.exec_driver_sql("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS has_hours BOOLEAN")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_restaurants_created ON restaurants (created_at, id)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_restaurants_city_created ON restaurants (city, created_at, id)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_restaurants_rating ON restaurants (rating_avg, rating_count, id)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_restaurants_city_rating ON restaurants (city, rating_avg, rating_count, id)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_restaurants_cell ON restaurants (cell)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_restaurants_search ON restaurants USING gin (search_vector)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_restaurant_reviews_restaurant ON restaurant_reviews (restaurant_id, created_at)")
                 # Create new tables if not exist (best-effort)
                 conn.exec_driver_sql("""
                 CREATE TABLE IF NOT EXISTS menu_categories (
@@ -170,6 +214,12 @@ def create_app() -> FastAPI:
                 """)
         except Exception:
             pass
+        # Discovery columns of restaurants and reviews written before them
+        try:
+            with SessionLocal() as db:
+                discovery.backfill(db)
+        except Exception:
+            pass
 
     @app.get("/health")
     def health():
@@ -221,6 +271,9 @@ def create_app() -> FastAPI:
             pass
         return response
 
+    # idempotency_requests_total{outcome=executed|replayed|coalesced|conflicts|...}
+    register_idempotency_metrics()
+
     @app.get("/metrics")
     def metrics():
         return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -237,6 +290,13 @@ def create_app() -> FastAPI:
     app.include_router(favorites_router.router)
     app.include_router(operator_router.router)
 
+    # Reporting rollups: incremental on every flush, plus the scheduled reconcile
+    rollups.install(SessionLocal)
+    # Restaurant discovery: ratings, opening hours, grid cell and search terms kept current on flush
+    discovery.install(SessionLocal)
+    if settings.ROLLUP_RECONCILE_INTERVAL_SECS > 0:
+        install_scheduler(app, build_scheduler())
+
     # Background webhook worker (dev/demo best-effort)
     if str(getattr(settings, "WEBHOOK_ENABLED", "false")).lower() in ("1","true","yes"):
         interval = int(getattr(settings, "WEBHOOK_WORKER_INTERVAL_SECS", 10))
@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, ForeignKey, Float, UniqueConstraint
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Integer, BigInteger, SmallInteger, Date, DateTime, Boolean, ForeignKey, Float, UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from sqlalchemy.orm import declarative_base, relationship
 
 
@@ -30,6 +30,15 @@ class User(Base):
 
 class Restaurant(Base):
     __tablename__ = "restaurants"
+    __table_args__ = (
+        # Discovery listings (utils/discovery.py): newest, best rated, nearest; text via the GIN index
+        Index("ix_restaurants_created", "created_at", "id"),
+        Index("ix_restaurants_city_created", "city", "created_at", "id"),
+        Index("ix_restaurants_rating", "rating_avg", "rating_count", "id"),
+        Index("ix_restaurants_city_rating", "city", "rating_avg", "rating_count", "id"),
+        Index("ix_restaurants_cell", "cell"),
+        Index("ix_restaurants_search", "search_vector", postgresql_using="gin"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     owner_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
@@ -45,12 +54,45 @@ class Restaurant(Base):
     is_open_override = Column(Boolean, nullable=True)
     busy_mode = Column(Boolean, nullable=False, default=False)
     max_orders_per_hour = Column(Integer, nullable=True)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    # Maintained by utils/discovery.py: grid cell of (latitude, longitude), review totals, search terms,
+    # and whether hours_json holds any hours (NULL until its rows in restaurant_hours are written)
+    cell = Column(BigInteger, nullable=True)
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_avg = Column(Float, nullable=False, default=0, server_default="0")
+    search_vector = Column(TSVECTOR, nullable=True)
+    has_hours = Column(Boolean, nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     items = relationship("MenuItem", back_populates="restaurant")
     orders = relationship("Order", back_populates="restaurant")
 
 
+class RestaurantHours(Base):
+    """Opening intervals parsed from ``hours_json`` (weekday rows) and ``special_hours_json`` (day rows).
+
+    Minutes are from midnight, both ends inclusive. A day row without minutes marks a special day: the
+    weekly rows don't apply then, only that date's own rows (its intervals and the previous date's overnight tail).
+    """
+
+    __tablename__ = "restaurant_hours"
+    __table_args__ = (
+        Index("ix_restaurant_hours_weekly", "restaurant_id", "weekday", "open_minute"),
+        Index("ix_restaurant_hours_day", "day", "restaurant_id"),
+        # Who is open now: one range scan per weekday
+        Index("ix_restaurant_hours_open", "weekday", "open_minute", "close_minute", "restaurant_id"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    restaurant_id = Column(UUID(as_uuid=True), ForeignKey("restaurants.id", ondelete="CASCADE"), nullable=False)
+    weekday = Column(SmallInteger, nullable=True)  # 0=Monday .. 6=Sunday
+    day = Column(Date, nullable=True)
+    open_minute = Column(SmallInteger, nullable=True)
+    close_minute = Column(SmallInteger, nullable=True)
+
+
 class OperatorMember(Base):
     __tablename__ = "food_operator_members"
 
@@ -154,6 +196,11 @@ class Order(Base):
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
     kds_bumped = Column(Boolean, nullable=False, default=False)
 
+    __table_args__ = (
+        # Per-restaurant time-range scans (rollup rebuilds, operator lists)
+        Index("ix_orders_restaurant_created", "restaurant_id", "created_at"),
+    )
+
 
 class OrderItem(Base):
     __tablename__ = "order_items"
@@ -174,6 +221,7 @@ class OrderItem(Base):
 
 class RestaurantReview(Base):
     __tablename__ = "restaurant_reviews"
+    __table_args__ = (Index("ix_restaurant_reviews_restaurant", "restaurant_id", "created_at"),)
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     restaurant_id = Column(UUID(as_uuid=True), ForeignKey("restaurants.id"), nullable=False)
@@ -280,3 +328,59 @@ class WebhookDelivery(Base):
     last_error = Column(String(512), nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+# --- Reporting rollups (maintained by utils/rollups.py) ---
+
+
+class _OrderRollupColumns:
+    restaurant_id = Column(UUID(as_uuid=True), ForeignKey("restaurants.id"), primary_key=True)
+    orders_total = Column(BigInteger, nullable=False, default=0)
+    orders_delivered = Column(BigInteger, nullable=False, default=0)
+    orders_canceled = Column(BigInteger, nullable=False, default=0)
+    # Sum of total_cents over all orders / delivered orders only
+    gross_cents = Column(BigInteger, nullable=False, default=0)
+    revenue_cents = Column(BigInteger, nullable=False, default=0)
+    # Durations (ms) for created->accepted, preparing->out, out->delivered, created->delivered
+    accepted_count = Column(BigInteger, nullable=False, default=0)
+    accepted_ms = Column(BigInteger, nullable=False, default=0)
+    prep_count = Column(BigInteger, nullable=False, default=0)
+    prep_ms = Column(BigInteger, nullable=False, default=0)
+    delivery_count = Column(BigInteger, nullable=False, default=0)
+    delivery_ms = Column(BigInteger, nullable=False, default=0)
+    total_count = Column(BigInteger, nullable=False, default=0)
+    total_ms = Column(BigInteger, nullable=False, default=0)
+
+
+class OrderRollupHourly(_OrderRollupColumns, Base):
+    __tablename__ = "order_rollups_hourly"
+
+    bucket_start = Column(DateTime, primary_key=True)
+
+
+class OrderRollupDaily(_OrderRollupColumns, Base):
+    __tablename__ = "order_rollups_daily"
+
+    bucket_start = Column(DateTime, primary_key=True)
+
+
+class OrderRollupLatencyBin(Base):
+    """Log-bucketed duration histogram; mergeable across buckets for percentiles."""
+
+    __tablename__ = "order_rollup_latency_bins"
+
+    grain = Column(String(1), primary_key=True)  # h|d
+    bucket_start = Column(DateTime, primary_key=True)
+    restaurant_id = Column(UUID(as_uuid=True), ForeignKey("restaurants.id"), primary_key=True)
+    metric = Column(String(16), primary_key=True)  # accepted|prep|delivery|total
+    bin = Column(SmallInteger, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+
+class OrderRollupItemDaily(Base):
+    __tablename__ = "order_rollup_items_daily"
+
+    bucket_start = Column(DateTime, primary_key=True)
+    restaurant_id = Column(UUID(as_uuid=True), ForeignKey("restaurants.id"), primary_key=True)
+    item_name = Column(String(128), primary_key=True)  # normalized name_snapshot
+    qty = Column(BigInteger, nullable=False, default=0)
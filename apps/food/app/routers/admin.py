@@ -1,15 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 
 from ..auth import get_current_user
 from ..database import get_db
-from ..models import User, Restaurant, Order, MenuItem, RestaurantImage, RestaurantReview
+from ..models import User, Restaurant, Order, MenuItem, RestaurantImage
 from ..schemas import OrdersListOut, OrderOut, OrderItemOut, RestaurantImageCreateIn, RestaurantImageOut, RestaurantOut, MenuItemOut
 from ..utils.notify import notify
 from ..utils.webhooks import send_webhooks
 from ..utils.audit import audit
 from ..utils.print_escpos import print_ticket
+from ..utils import discovery
 
 
 router = APIRouter(prefix="/admin", tags=["admin"])
@@ -48,41 +48,22 @@ def dev_become_owner(restaurant_id: str, user: User = Depends(get_current_user),
 
 @router.get("/restaurants/mine", response_model=list[RestaurantOut])
 def list_my_restaurants(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    rows = (
-        db.query(Restaurant)
-        .filter(Restaurant.owner_user_id == user.id)
+    rows = db.execute(
+        discovery.listing()
+        .where(Restaurant.owner_user_id == user.id)
         .order_by(Restaurant.created_at.desc())
-        .all()
-    )
-    out: list[RestaurantOut] = []
-    for r in rows:
-        avg, cnt = (
-            db.query(func.avg(RestaurantReview.rating), func.count(RestaurantReview.id))
-            .filter(RestaurantReview.restaurant_id == r.id)
-            .one()
-        )
-        out.append(
-            RestaurantOut(
-                id=str(r.id),
-                name=r.name,
-                city=r.city,
-                description=r.description,
-                address=r.address,
-                rating_avg=float(avg) if avg is not None else None,
-                rating_count=int(cnt) if cnt is not None else 0,
-            )
-        )
-    return out
+    ).all()
+    return [discovery.restaurant_out(r, is_open) for r, is_open in rows]
 
 
 @router.patch("/restaurants/{restaurant_id}")
-def update_restaurant(restaurant_id: str, name: str | None = None, city: str | None = None, description: str | None = None, address: str | None = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_restaurant(restaurant_id: str, name: str | None = None, city: str | None = None, description: str | None = None, address: str | None = None, latitude: float | None = Query(None, ge=-90, le=90), longitude: float | None = Query(None, ge=-180, le=180), user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     r = db.get(Restaurant, restaurant_id)
     if not r:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Restaurant not found")
     if r.owner_user_id != user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not your restaurant")
-    before = {"name": r.name, "city": r.city, "description": r.description, "address": r.address}
+    before = {"name": r.name, "city": r.city, "description": r.description, "address": r.address, "latitude": r.latitude, "longitude": r.longitude}
     if name is not None:
         r.name = name
     if city is not None:
@@ -91,7 +72,11 @@ def update_restaurant(restaurant_id: str, name: str | None = None, city: str | N
         r.description = description
     if address is not None:
         r.address = address
-    audit(db, user_id=str(user.id), action="restaurant.update", entity_type="restaurant", entity_id=str(restaurant_id), before=before, after={"name": r.name, "city": r.city, "description": r.description, "address": r.address})
+    if latitude is not None:
+        r.latitude = latitude
+    if longitude is not None:
+        r.longitude = longitude
+    audit(db, user_id=str(user.id), action="restaurant.update", entity_type="restaurant", entity_id=str(restaurant_id), before=before, after={"name": r.name, "city": r.city, "description": r.description, "address": r.address, "latitude": r.latitude, "longitude": r.longitude})
     return {"detail": "ok"}
 
 
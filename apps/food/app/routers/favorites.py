@@ -5,6 +5,7 @@ from ..auth import get_current_user
 from ..database import get_db
 from ..models import FavoriteRestaurant, Restaurant, User
 from ..schemas import RestaurantOut
+from ..utils import discovery
 
 
 router = APIRouter(prefix="/restaurants", tags=["favorites"])
@@ -38,10 +39,10 @@ def unfavorite_restaurant(restaurant_id: str, user: User = Depends(get_current_u
 
 @router.get("/favorites", response_model=list[RestaurantOut])
 def list_favorites(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    favs = db.query(FavoriteRestaurant).filter(FavoriteRestaurant.user_id == user.id).all()
-    ids = [f.restaurant_id for f in favs]
-    if not ids:
-        return []
-    rows = db.query(Restaurant).filter(Restaurant.id.in_(ids)).all()
-    return [RestaurantOut(id=str(r.id), name=r.name, city=r.city, description=r.description, address=r.address) for r in rows]
+    rows = db.execute(
+        discovery.listing()
+        .join(FavoriteRestaurant, FavoriteRestaurant.restaurant_id == Restaurant.id)
+        .where(FavoriteRestaurant.user_id == user.id)
+    ).all()
+    return [discovery.restaurant_out(r, is_open) for r, is_open in rows]
 
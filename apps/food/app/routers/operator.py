@@ -1,12 +1,11 @@
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 
 from ..auth import get_current_user
 from ..database import get_db
 from ..config import settings
-from ..models import User, Restaurant, Order, MenuItem, OperatorMember, RestaurantReview, RestaurantImage, MenuCategory, ModifierGroup, ModifierOption, MenuItemModifierGroup, RestaurantStation
+from ..models import User, Restaurant, Order, MenuItem, OperatorMember, RestaurantImage, MenuCategory, ModifierGroup, ModifierOption, MenuItemModifierGroup, RestaurantStation
 from ..schemas import (
     RestaurantOut,
     OrdersListOut,
@@ -28,6 +27,7 @@ from ..utils.webhooks import send_webhooks
 from ..utils.webhooks import process_pending_once
 from ..utils.audit import audit
 from ..utils.print_escpos import print_ticket
+from ..utils import discovery, rollups
 
 
 router = APIRouter(prefix="/operator", tags=["operator"])
@@ -60,43 +60,24 @@ def dev_become_admin(user: User = Depends(get_current_user), db: Session = Depen
 @router.get("/restaurants", response_model=list[RestaurantOut])
 def list_restaurants(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    rows = db.query(Restaurant).order_by(Restaurant.created_at.desc()).limit(500).all()
+    rows = db.execute(discovery.listing().order_by(Restaurant.created_at.desc()).limit(500)).all()
     out: list[RestaurantOut] = []
-    for r in rows:
-        avg, cnt = (
-            db.query(func.avg(RestaurantReview.rating), func.count(RestaurantReview.id))
-            .filter(RestaurantReview.restaurant_id == r.id)
-            .one()
-        )
+    for r, is_open in rows:
         hours_dict = None
-        is_open = None
         if r.hours_json:
             try:
                 import json as _json
                 hours_dict = _json.loads(r.hours_json)
             except Exception:
                 hours_dict = None
-        is_open = _compute_is_open(hours_dict, r.is_open_override)
-        out.append(
-            RestaurantOut(
-                id=str(r.id),
-                name=r.name,
-                city=r.city,
-                description=r.description,
-                address=r.address,
-                rating_avg=float(avg) if avg is not None else None,
-                rating_count=int(cnt) if cnt is not None else 0,
-                is_open=is_open,
-                hours=hours_dict,
-            )
-        )
+        out.append(discovery.restaurant_out(r, is_open, hours=hours_dict))
     return out
 
 
 @router.post("/restaurants")
-def create_restaurant(name: str, city: str | None = None, address: str | None = None, owner_phone: str | None = None, hours_json: str | None = None, is_open_override: bool | None = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_restaurant(name: str, city: str | None = None, address: str | None = None, owner_phone: str | None = None, hours_json: str | None = None, is_open_override: bool | None = None, latitude: float | None = Query(None, ge=-90, le=90), longitude: float | None = Query(None, ge=-180, le=180), user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="admin")
-    r = Restaurant(name=name, city=city, address=address, hours_json=hours_json, is_open_override=is_open_override)
+    r = Restaurant(name=name, city=city, address=address, hours_json=hours_json, is_open_override=is_open_override, latitude=latitude, longitude=longitude)
     if owner_phone:
         owner = db.query(User).filter(User.phone == owner_phone).one_or_none()
         if owner is None:
@@ -110,7 +91,7 @@ def create_restaurant(name: str, city: str | None = None, address: str | None =
 
 
 @router.patch("/restaurants/{restaurant_id}")
-def update_restaurant(restaurant_id: str, name: str | None = None, city: str | None = None, description: str | None = None, address: str | None = None, owner_phone: str | None = None, hours_json: str | None = None, is_open_override: bool | None = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_restaurant(restaurant_id: str, name: str | None = None, city: str | None = None, description: str | None = None, address: str | None = None, owner_phone: str | None = None, hours_json: str | None = None, is_open_override: bool | None = None, latitude: float | None = Query(None, ge=-90, le=90), longitude: float | None = Query(None, ge=-180, le=180), user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="admin")
     r = db.get(Restaurant, restaurant_id)
     if not r:
@@ -127,6 +108,10 @@ def update_restaurant(restaurant_id: str, name: str | None = None, city: str | N
         r.hours_json = hours_json
     if is_open_override is not None:
         r.is_open_override = is_open_override
+    if latitude is not None:
+        r.latitude = latitude
+    if longitude is not None:
+        r.longitude = longitude
     if owner_phone is not None:
         owner = db.query(User).filter(User.phone == owner_phone).one_or_none()
         if owner is None:
@@ -156,17 +141,14 @@ def list_all_orders(status_filter: str | None = None, user: User = Depends(get_c
 @router.get("/reports/summary")
 def summary(days: int = 7, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    to = datetime.utcnow()
-    fr = to - timedelta(days=max(1, min(days, 90)))
-    total_orders = db.query(func.count(Order.id)).filter(Order.created_at >= fr, Order.created_at <= to).scalar() or 0
-    delivered = db.query(func.count(Order.id)).filter(Order.status == "delivered", Order.created_at >= fr, Order.created_at <= to).scalar() or 0
-    revenue = db.query(func.sum(Order.total_cents)).filter(Order.status == "delivered", Order.created_at >= fr, Order.created_at <= to).scalar() or 0
+    fr, to = rollups.window(days, 90)
+    t = rollups.totals(db, fr, to)
     return {
         "from_utc": fr.isoformat() + "Z",
         "to_utc": to.isoformat() + "Z",
-        "orders_total": int(total_orders),
-        "orders_delivered": int(delivered),
-        "gross_revenue_cents": int(revenue or 0),
+        "orders_total": t["orders_total"],
+        "orders_delivered": t["orders_delivered"],
+        "gross_revenue_cents": t["revenue_cents"],
     }
 
 from fastapi import Response
@@ -970,25 +952,17 @@ def delete_member(member_id: str, user: User = Depends(get_current_user), db: Se
 @router.get("/reports/top_items")
 def top_items(days: int = 30, limit: int = 10, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    to = datetime.utcnow()
-    fr = to - timedelta(days=max(1, min(days, 180)))
-    # Aggregate in Python over recent orders; robust to later menu edits via name_snapshot
-    from collections import Counter
-    cnt: Counter[str] = Counter()
-    for o in db.query(Order).filter(Order.created_at >= fr, Order.created_at <= to).all():
-        for it in o.items:
-            key = it.name_snapshot.strip().lower()
-            cnt[key] += it.qty
-    top = cnt.most_common(limit)
-    return [{"name": name, "qty": qty} for name, qty in top]
+    fr, to = rollups.window(days, 180)
+    # name_snapshot is normalized (strip/lower) when rolled up; robust to later menu edits
+    return [{"name": name, "qty": qty} for name, qty in rollups.top_items(db, fr, to, limit)]
 
 
 @router.get("/reports/cancellation_rate")
 def cancellation_rate(days: int = 30, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    to = datetime.utcnow(); fr = to - timedelta(days=max(1, min(days, 180)))
-    total = db.query(func.count(Order.id)).filter(Order.created_at >= fr, Order.created_at <= to).scalar() or 0
-    canceled = db.query(func.count(Order.id)).filter(Order.created_at >= fr, Order.created_at <= to, Order.status == "canceled").scalar() or 0
+    fr, to = rollups.window(days, 180)
+    t = rollups.totals(db, fr, to)
+    total, canceled = t["orders_total"], t["orders_canceled"]
     rate = (float(canceled) / float(total)) if total else 0.0
     return {"from_utc": fr.isoformat()+"Z", "to_utc": to.isoformat()+"Z", "orders_total": int(total), "orders_canceled": int(canceled), "cancellation_rate": rate}
 
@@ -996,47 +970,26 @@ def cancellation_rate(days: int = 30, user: User = Depends(get_current_user), db
 @router.get("/reports/sla")
 def sla(days: int = 30, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    to = datetime.utcnow(); fr = to - timedelta(days=max(1, min(days, 180)))
-    rows = db.query(Order).filter(Order.created_at >= fr, Order.created_at <= to).all()
-    import statistics as _st
-    acc_durs = []
-    cook_durs = []
-    ship_durs = []
-    total_durs = []
-    for o in rows:
-        if o.accepted_at and o.created_at:
-            acc_durs.append((o.accepted_at - o.created_at).total_seconds())
-        if o.out_for_delivery_at and o.preparing_at:
-            cook_durs.append((o.out_for_delivery_at - o.preparing_at).total_seconds())
-        if o.delivered_at and o.out_for_delivery_at:
-            ship_durs.append((o.delivered_at - o.out_for_delivery_at).total_seconds())
-        if o.delivered_at and o.created_at:
-            total_durs.append((o.delivered_at - o.created_at).total_seconds())
-    def _stats(a):
-        return {"count": len(a), "avg_secs": (sum(a)/len(a) if a else 0), "p50_secs": (_st.median(a) if a else 0), "p90_secs": (_st.quantiles(a, n=10)[8] if len(a) >= 10 else (_st.median(a) if a else 0))}
+    fr, to = rollups.window(days, 180)
+    t = rollups.totals(db, fr, to)
+    bins = rollups.latency(db, fr, to)
+    def _stats(metric):
+        return rollups.stage_stats(t[f"{metric}_count"], t[f"{metric}_ms"], bins.get(metric, {}))
     return {
         "from_utc": fr.isoformat()+"Z",
         "to_utc": to.isoformat()+"Z",
-        "accepted_latency": _stats(acc_durs),
-        "preparing_to_out_latency": _stats(cook_durs),
-        "out_to_delivered_latency": _stats(ship_durs),
-        "created_to_delivered_latency": _stats(total_durs),
+        "accepted_latency": _stats("accepted"),
+        "preparing_to_out_latency": _stats("prep"),
+        "out_to_delivered_latency": _stats("delivery"),
+        "created_to_delivered_latency": _stats("total"),
     }
 
 
 @router.get("/reports/peaks")
 def peaks(days: int = 30, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    to = datetime.utcnow(); fr = to - timedelta(days=max(1, min(days, 180)))
-    rows = db.query(Order.created_at).filter(Order.created_at >= fr, Order.created_at <= to).all()
-    from collections import Counter
-    hours = Counter(); dows = Counter()
-    for (dt,) in rows:
-        if not dt:
-            continue
-        h = dt.hour; w = dt.weekday()
-        hours[h] += 1
-        dows[w] += 1
+    fr, to = rollups.window(days, 180)
+    hours, dows = rollups.peaks(db, fr, to)
     return {
         "from_utc": fr.isoformat()+"Z",
         "to_utc": to.isoformat()+"Z",
@@ -1048,27 +1001,15 @@ def peaks(days: int = 30, user: User = Depends(get_current_user), db: Session =
 @router.get("/reports/by_restaurant")
 def by_restaurant(days: int = 30, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    to = datetime.utcnow()
-    fr = to - timedelta(days=max(1, min(days, 180)))
-    rows = (
-        db.query(
-            Restaurant.id.label("restaurant_id"),
-            Restaurant.name.label("restaurant_name"),
-            func.count(Order.id).label("orders"),
-            func.sum(Order.total_cents).label("revenue_cents"),
-        )
-        .join(Order, Order.restaurant_id == Restaurant.id)
-        .filter(Order.created_at >= fr, Order.created_at <= to)
-        .group_by(Restaurant.id, Restaurant.name)
-        .order_by(func.sum(Order.total_cents).desc())
-        .all()
-    )
+    fr, to = rollups.window(days, 180)
+    rows = [r for r in rollups.totals(db, fr, to, by="restaurant") if r.orders_total]
+    rows.sort(key=lambda r: int(r.gross_cents or 0), reverse=True)
     return [
         {
             "restaurant_id": str(r.restaurant_id),
             "restaurant_name": r.restaurant_name,
-            "orders": int(r.orders or 0),
-            "revenue_cents": int(r.revenue_cents or 0),
+            "orders": int(r.orders_total or 0),
+            "revenue_cents": int(r.gross_cents or 0),
         }
         for r in rows
     ]
@@ -1091,23 +1032,14 @@ def by_restaurant_xlsx(days: int = 30, user: User = Depends(get_current_user), d
 @router.get("/reports/payout")
 def payout_report(days: int = 30, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    to = datetime.utcnow(); fr = to - timedelta(days=max(1, min(days, 90)))
-    rows = (
-        db.query(
-            Restaurant.id.label("restaurant_id"),
-            Restaurant.name.label("restaurant_name"),
-            func.sum(Order.total_cents).label("gross"),
-        ).join(Order, Order.restaurant_id == Restaurant.id)
-        .filter(Order.created_at >= fr, Order.created_at <= to, Order.status == "delivered")
-        .group_by(Restaurant.id, Restaurant.name)
-        .all()
-    )
+    fr, to = rollups.window(days, 90)
+    rows = [r for r in rollups.totals(db, fr, to, by="restaurant") if r.orders_delivered]
     fee_bps = int(getattr(settings, "PLATFORM_FEE_BPS", 0))
     tax_bps = int(getattr(settings, "TAX_RATE_BPS", 0))
     out_rows = []
     total_gross = total_fee = total_tax = total_net = 0
     for r in rows:
-        gross = int(r.gross or 0)
+        gross = int(r.revenue_cents or 0)
         fee = gross * fee_bps // 10000
         tax = gross * tax_bps // 10000
         net = gross - fee - tax
@@ -1190,25 +1122,14 @@ def by_restaurant_csv(days: int = 30, user: User = Depends(get_current_user), db
 @router.get("/reports/by_city")
 def by_city(days: int = 30, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="agent")
-    to = datetime.utcnow()
-    fr = to - timedelta(days=max(1, min(days, 180)))
-    rows = (
-        db.query(
-            Restaurant.city.label("city"),
-            func.count(Order.id).label("orders"),
-            func.sum(Order.total_cents).label("revenue_cents"),
-        )
-        .join(Order, Order.restaurant_id == Restaurant.id)
-        .filter(Order.created_at >= fr, Order.created_at <= to)
-        .group_by(Restaurant.city)
-        .order_by(func.sum(Order.total_cents).desc())
-        .all()
-    )
+    fr, to = rollups.window(days, 180)
+    rows = [r for r in rollups.totals(db, fr, to, by="city") if r.orders_total]
+    rows.sort(key=lambda r: int(r.gross_cents or 0), reverse=True)
     return [
         {
             "city": r.city,
-            "orders": int(r.orders or 0),
-            "revenue_cents": int(r.revenue_cents or 0),
+            "orders": int(r.orders_total or 0),
+            "revenue_cents": int(r.gross_cents or 0),
         }
         for r in rows
     ]
@@ -1224,6 +1145,15 @@ def by_city_csv(days: int = 30, user: User = Depends(get_current_user), db: Sess
     return Response(buf.getvalue(), media_type="text/csv")
 
 
+@router.post("/reports/rollups/rebuild")
+def rebuild_rollups(days: int = 2, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Recompute reporting rollups from orders (backfill / repair)."""
+    _ensure_operator(db, user.id, min_role="admin")
+    since = datetime.utcnow() - timedelta(days=max(1, min(days, 3650)))
+    n = rollups.rebuild(db, since)
+    return {"detail": "ok", "orders": n, "since_utc": rollups.day_floor(since).isoformat() + "Z"}
+
+
 @router.post("/webhooks/retry")
 def webhooks_retry(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     _ensure_operator(db, user.id, min_role="admin")
@@ -1,17 +1,20 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
 
+from superapp_shared.listing import set_next_link
+
 from ..auth import get_current_user
 from ..database import get_db
-from ..models import Restaurant, MenuItem, User, RestaurantReview, RestaurantImage
+from ..models import Restaurant, MenuItem, User, RestaurantImage
 from ..schemas import RestaurantOut, MenuItemOut, RestaurantImageOut
+from ..utils import discovery
 
 
 router = APIRouter(prefix="/restaurants", tags=["restaurants"])
 
 
 def _seed_dev(db: Session):
-    if db.query(Restaurant).count() > 0:
+    if db.query(Restaurant.id).limit(1).first() is not None:
         return
     r1 = Restaurant(name="Damascus Eats", city="Damascus", description="Local favorites")
     r2 = Restaurant(name="Aleppo Grill", city="Aleppo", description="Grilled goodness")
@@ -28,74 +31,32 @@ def _seed_dev(db: Session):
 
 
 @router.get("", response_model=list[RestaurantOut])
-def list_restaurants(user: User = Depends(get_current_user), db: Session = Depends(get_db), city: str | None = None, q: str | None = None, limit: int = 50, offset: int = 0):
+def list_restaurants(
+    request: Request,
+    response: Response,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    city: str | None = None,
+    q: str | None = None,
+    lat: float | None = Query(None, ge=-90, le=90),
+    lon: float | None = Query(None, ge=-180, le=180),
+    radius_km: float | None = Query(None, gt=0, le=100),
+    open_now: bool = False,
+    sort: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(50, gt=0, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """Newest first, or nearest first around ``lat``/``lon`` (``sort=rating`` also works); the next page is linked in the ``Link`` header."""
     _seed_dev(db)
-    query = db.query(Restaurant)
-    if city:
-        query = query.filter(Restaurant.city == city)
-    rows = query.order_by(Restaurant.created_at.desc()).limit(limit).offset(offset).all()
-    out: list[RestaurantOut] = []
-    from sqlalchemy import func
-    def _compute_is_open(hours: dict | None, override: bool | None, specials: dict | None = None) -> bool | None:
-        if override is not None:
-            return bool(override)
-        if not hours:
-            return None
-        try:
-            import datetime as _dt
-            now = _dt.datetime.utcnow()
-            if specials:
-                key = now.strftime("%Y-%m-%d")
-                if key in specials:
-                    slots = specials.get(key) or []
-                    if slots in ([], None, "closed"):
-                        return False
-                    hm = now.hour * 60 + now.minute
-                    for s in slots:
-                        if not isinstance(s, (list, tuple)) or len(s) != 2:
-                            continue
-                        a, b = s
-                        ah, am = map(int, str(a).split(":"))
-                        bh, bm = map(int, str(b).split(":"))
-                        if (ah*60+am) <= hm <= (bh*60+bm):
-                            return True
-                    return False
-            weekday = ["mon","tue","wed","thu","fri","sat","sun"][now.weekday()]
-            slots = hours.get(weekday) or []
-            hm = now.hour * 60 + now.minute
-            for s in slots:
-                if not isinstance(s, (list, tuple)) or len(s) != 2:
-                    continue
-                a, b = s
-                ah, am = map(int, str(a).split(":"))
-                bh, bm = map(int, str(b).split(":"))
-                if (ah*60+am) <= hm <= (bh*60+bm):
-                    return True
-            return False
-        except Exception:
-            return None
-
-    for r in rows:
-        if q and q.lower() not in ((r.name or "") + " " + (r.description or "")).lower():
-            continue
-        avg, cnt = db.query(func.avg(RestaurantReview.rating), func.count(RestaurantReview.id)).filter(RestaurantReview.restaurant_id == r.id).one()
-        hours_dict = None
-        if getattr(r, "hours_json", None):
-            try:
-                import json as _json
-                hours_dict = _json.loads(r.hours_json)
-            except Exception:
-                hours_dict = None
-        specials = None
-        if getattr(r, "special_hours_json", None):
-            try:
-                import json as _json
-                specials = _json.loads(r.special_hours_json)
-            except Exception:
-                specials = None
-        is_open = _compute_is_open(hours_dict, getattr(r, "is_open_override", None), specials)
-        out.append(RestaurantOut(id=str(r.id), name=r.name, city=r.city, description=r.description, address=r.address, rating_avg=float(avg) if avg is not None else None, rating_count=int(cnt) if cnt is not None else 0, is_open=is_open))
-    return out
+    try:
+        rows, next_cursor = discovery.page(
+            db, city=city, q=q, lat=lat, lon=lon, radius_km=radius_km, open_now=open_now, sort=sort, cursor=cursor, limit=limit, offset=offset,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    set_next_link(request, response, next_cursor, limit)
+    return rows
 
 
 @router.get("/{restaurant_id}/menu", response_model=list[MenuItemOut])
@@ -30,6 +30,9 @@ class RestaurantOut(BaseModel):
     rating_count: Optional[int] = None
     is_open: Optional[bool] = None
     hours: Optional[Dict[str, Any]] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    distance_km: Optional[float] = None
 
 
 class RestaurantImageCreateIn(BaseModel):
@@ -0,0 +1,392 @@
+"""Restaurant discovery: filtered, ranked and paged listings in one query per page.
+
+Everything a listing shows, filters or ranks on is kept on the restaurant row
+(or in an indexed side table) when it is written, instead of being computed
+per restaurant on read:
+
+- ``rating_count`` / ``rating_sum`` / ``rating_avg``: reviews added or removed
+  in a flush are applied as ``col = col + delta`` in the same transaction.
+- ``restaurant_hours``: ``hours_json`` and ``special_hours_json`` parsed into
+  minute intervals whenever either changes, so "open now" is an indexed
+  ``EXISTS`` in the listing query (``open_now_expr``). ``has_hours`` records
+  whether any weekly hours are set. Times are UTC, as before; an interval
+  that closes before it opens runs past midnight into the next day.
+- ``cell``: grid cell of ``latitude``/``longitude`` (``FOOD_GEO_CELL_DEG``), so
+  "near me" reads only the cells around the point before the exact distance.
+- ``search_vector``: name, description and city as a ``simple`` tsvector
+  (GIN indexed). ``q`` matches word prefixes, all words required.
+
+Rows changed with Core/bulk statements bypass the flush hooks; ``backfill``
+(run at startup) repairs anything left unset or out of step.
+
+Pages are keyset paged on (sort key, id), so walking every page returns each
+matching restaurant exactly once.
+"""
+from __future__ import annotations
+
+import json
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Float, and_, bindparam, case, cast, event, func, inspect, null, or_, select, text, tuple_, update
+from sqlalchemy.orm import Session
+
+from superapp_shared.geo import EARTH_RADIUS_M, cell_id, cells_around
+from superapp_shared.listing import decode_cursor, encode_cursor, prefix_tsquery
+
+from ..config import settings
+from ..models import Restaurant, RestaurantHours, RestaurantReview
+from ..schemas import RestaurantOut
+
+
+SORTS = ("newest", "rating", "distance")
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DAY_MINUTES = 24 * 60
+_SEARCHED = ("name", "description", "city")
+_HOURS = ("hours_json", "special_hours_json")
+
+
+# --- opening hours ----------------------------------------------------------
+
+
+def _minute(hm: Any) -> int:
+    h, m = map(int, str(hm).split(":"))
+    if not (0 <= h <= 24 and 0 <= m < 60) or h * 60 + m > DAY_MINUTES:
+        raise ValueError(f"invalid time {hm!r}")
+    return h * 60 + m
+
+
+def _intervals(slots: Any) -> List[Tuple[int, int]]:
+    out = []
+    for s in slots if isinstance(slots, list) else []:
+        if not isinstance(s, (list, tuple)) or len(s) != 2:
+            continue
+        try:
+            out.append((_minute(s[0]), _minute(s[1])))
+        except ValueError:
+            continue
+    return out
+
+
+def _loads(raw: Optional[str]) -> Optional[dict]:
+    if not raw:
+        return None
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def parse_hours(hours_json: Optional[str], special_hours_json: Optional[str]) -> Tuple[bool, List[Dict[str, Any]]]:
+    """``(has_hours, restaurant_hours rows)`` for the two JSON columns.
+
+    ``hours_json`` maps ``mon``..``sun`` to ``[["09:00", "17:00"], ...]``;
+    ``special_hours_json`` maps ``YYYY-MM-DD`` to the same, or to ``"closed"``
+    / ``[]`` for a day off. Malformed intervals are skipped.
+    """
+    hours = _loads(hours_json)
+    rows: List[Dict[str, Any]] = []
+    for wd, key in enumerate(WEEKDAYS):
+        for a, b in _intervals((hours or {}).get(key)):
+            if a <= b:
+                rows.append({"weekday": wd, "day": None, "open_minute": a, "close_minute": b})
+            else:
+                rows.append({"weekday": wd, "day": None, "open_minute": a, "close_minute": DAY_MINUTES})
+                rows.append({"weekday": (wd + 1) % 7, "day": None, "open_minute": 0, "close_minute": b})
+    for key, slots in (_loads(special_hours_json) or {}).items():
+        try:
+            day = date.fromisoformat(str(key))
+        except ValueError:
+            continue
+        # A special day replaces the weekly hours: its row without minutes marks the day (and keeps it closed)
+        rows.append({"weekday": None, "day": day, "open_minute": None, "close_minute": None})
+        for a, b in _intervals(slots):
+            if a <= b:
+                rows.append({"weekday": None, "day": day, "open_minute": a, "close_minute": b})
+            else:
+                # Past midnight: the tail is an interval of the next date, on top of that day's own hours
+                rows.append({"weekday": None, "day": day, "open_minute": a, "close_minute": DAY_MINUTES})
+                rows.append({"weekday": None, "day": day + timedelta(days=1), "open_minute": 0, "close_minute": b})
+    return bool(hours), rows
+
+
+def sync_hours(db, restaurant_ids, hours: Dict[Any, Tuple[Optional[str], Optional[str]]]) -> None:
+    """Rewrite ``restaurant_hours`` and ``has_hours`` for these restaurants from ``{id: (hours_json, special_hours_json)}``."""
+    ids = list(restaurant_ids)
+    if not ids:
+        return
+    t, r = RestaurantHours.__table__, Restaurant.__table__
+    db.execute(t.delete().where(t.c.restaurant_id.in_(ids)))
+    rows, flags = [], []
+    for rid in ids:
+        has_hours, parsed = parse_hours(*hours[rid])
+        rows += [{"restaurant_id": rid, **row} for row in parsed]
+        flags.append({"b_id": rid, "b_has": has_hours})
+    if rows:
+        db.execute(t.insert(), rows)
+    db.execute(update(r).where(r.c.id == bindparam("b_id")).values(has_hours=bindparam("b_has")), flags)
+
+
+def open_now_expr(now: Optional[datetime] = None):
+    """SQL for ``is_open``: the override if set, NULL without weekly hours, else whether ``now`` (UTC) falls in an interval.
+
+    The intervals are read by one correlated aggregate per restaurant (an
+    ``EXISTS`` would be planned as a hash of the whole table).
+    """
+    now = now or datetime.utcnow()
+    minute = now.hour * 60 + now.minute
+    today = date(now.year, now.month, now.day)
+    h = RestaurantHours
+    within = and_(h.open_minute <= minute, h.close_minute >= minute)
+    special = h.day.isnot(None)
+    # A special day (marked by its row without minutes) replaces the weekly hours
+    marked = and_(h.day == today, h.open_minute.is_(None))
+    from_rows = (
+        select(case(
+            (func.bool_or(marked), func.coalesce(func.bool_or(and_(special, within)), False)),
+            else_=func.coalesce(func.bool_or(within), False),
+        ))
+        .where(h.restaurant_id == Restaurant.id, or_(h.day == today, h.weekday == now.weekday()))
+        .scalar_subquery()
+    )
+    return case(
+        (Restaurant.is_open_override.isnot(None), Restaurant.is_open_override),
+        (func.coalesce(Restaurant.has_hours, False).is_(False), null()),
+        else_=from_rows,
+    )
+
+
+def open_now_filter(now: Optional[datetime] = None):
+    """``open_now_expr(now) IS TRUE`` as a probe into the set of restaurants open now, read once per query."""
+    now = now or datetime.utcnow()
+    minute = now.hour * 60 + now.minute
+    today = date(now.year, now.month, now.day)
+    h = RestaurantHours
+    within = and_(h.open_minute <= minute, h.close_minute >= minute)
+    special_today = select(h.restaurant_id).where(h.day == today, h.open_minute.is_(None))
+    open_special = select(h.restaurant_id).where(h.day == today, within)
+    open_weekly = select(h.restaurant_id).where(h.weekday == now.weekday(), within)
+    return or_(
+        Restaurant.is_open_override.is_(True),
+        and_(
+            Restaurant.is_open_override.is_(None),
+            Restaurant.has_hours.is_(True),
+            or_(Restaurant.id.in_(open_special), and_(Restaurant.id.in_(open_weekly), Restaurant.id.not_in(special_today))),
+        ),
+    )
+
+
+# --- search and distance -----------------------------------------------------
+
+
+def distance_km_expr(lat: float, lon: float):
+    """Great-circle distance from the point in km (NULL for restaurants without coordinates)."""
+    d_lat = func.radians(Restaurant.latitude - lat)
+    d_lon = func.radians(Restaurant.longitude - lon)
+    a = func.power(func.sin(d_lat / 2), 2) + func.cos(func.radians(lat)) * func.cos(func.radians(Restaurant.latitude)) * func.power(func.sin(d_lon / 2), 2)
+    return 2 * (EARTH_RADIUS_M / 1000.0) * func.asin(func.least(1.0, func.sqrt(a)))
+
+
+def restaurant_out(r: Restaurant, is_open: Optional[bool], distance_km: Optional[float] = None, hours: Optional[dict] = None) -> RestaurantOut:
+    return RestaurantOut(
+        id=str(r.id), name=r.name, city=r.city, description=r.description, address=r.address,
+        rating_avg=r.rating_avg if r.rating_count else None, rating_count=r.rating_count or 0,
+        is_open=is_open, hours=hours, latitude=r.latitude, longitude=r.longitude,
+        distance_km=round(distance_km, 3) if distance_km is not None else None,
+    )
+
+
+def listing(now: Optional[datetime] = None):
+    """``select(Restaurant, is_open)`` for callers with their own filters and order."""
+    return select(Restaurant, open_now_expr(now).label("is_open"))
+
+
+# --- keyset pages ------------------------------------------------------------
+
+
+def _cursor(sort: str, r: Restaurant, distance_km: Optional[float]) -> str:
+    if sort == "rating":
+        return encode_cursor(sort, (r.rating_avg, r.rating_count), r.id)
+    return encode_cursor(sort, distance_km if sort == "distance" else r.created_at, r.id)
+
+
+def _cursor_value(sort: str):
+    if sort == "rating":
+        return lambda v: (float(v[0]), int(v[1]))
+    return float if sort == "distance" else datetime.fromisoformat
+
+
+def page(
+    db: Session,
+    *,
+    city: Optional[str] = None,
+    q: Optional[str] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    radius_km: Optional[float] = None,
+    open_now: bool = False,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+    now: Optional[datetime] = None,
+) -> Tuple[List[RestaurantOut], Optional[str]]:
+    """One page of restaurants and the cursor of the next one; a single query however long the page.
+
+    With ``lat``/``lon`` only restaurants within ``radius_km`` are listed, nearest
+    first unless another ``sort`` is asked for; without them ``newest`` is the default.
+    """
+    near = lat is not None and lon is not None
+    sort = sort or ("distance" if near else "newest")
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    if (lat is None) != (lon is None):
+        raise ValueError("lat and lon go together")
+    if sort == "distance" and not near:
+        raise ValueError("sort=distance needs lat and lon")
+    is_open = open_now_expr(now)
+    dist = distance_km_expr(lat, lon) if near else cast(null(), Float)
+    stmt = select(Restaurant, is_open.label("is_open"), dist.label("distance_km"))
+    if city:
+        stmt = stmt.where(Restaurant.city == city)
+    tsq = prefix_tsquery(q)
+    if tsq is not None:
+        stmt = stmt.where(Restaurant.search_vector.op("@@")(tsq))
+    if near:
+        radius_km = settings.FOOD_NEAR_RADIUS_KM if radius_km is None else radius_km
+        stmt = stmt.where(Restaurant.cell.in_(cells_around(lat, lon, radius_km * 1000, settings.FOOD_GEO_CELL_DEG)), dist <= radius_km)
+    if open_now:
+        stmt = stmt.where(open_now_filter(now))
+    if cursor:
+        value, rid = decode_cursor(cursor, sort, _cursor_value(sort))
+        if sort == "rating":
+            stmt = stmt.where(tuple_(Restaurant.rating_avg, Restaurant.rating_count, Restaurant.id) < tuple_(value[0], value[1], rid))
+        elif sort == "distance":
+            stmt = stmt.where(tuple_(dist, Restaurant.id) > tuple_(value, rid))
+        else:
+            stmt = stmt.where(tuple_(Restaurant.created_at, Restaurant.id) < tuple_(value, rid))
+    if sort == "rating":
+        stmt = stmt.order_by(Restaurant.rating_avg.desc(), Restaurant.rating_count.desc(), Restaurant.id.desc())
+    elif sort == "distance":
+        stmt = stmt.order_by(dist.asc(), Restaurant.id.asc())
+    else:
+        stmt = stmt.order_by(Restaurant.created_at.desc(), Restaurant.id.desc())
+    rows = db.execute(stmt.offset(offset).limit(limit + 1)).all()
+    next_cursor = _cursor(sort, rows[limit - 1][0], rows[limit - 1][2]) if len(rows) > limit else None
+    return [restaurant_out(r, o, d) for r, o, d in rows[:limit]], next_cursor
+
+
+# --- maintenance --------------------------------------------------------------
+
+
+def _search_vector(name: Optional[str], description: Optional[str], city: Optional[str]):
+    return func.to_tsvector("simple", " ".join(p for p in (name, description, city) if p))
+
+
+def backfill(db: Session, batch: int = 1000) -> Dict[str, int]:
+    """Fill the discovery columns of restaurants (and reviews) written before them, or by Core/bulk statements."""
+    done = {}
+    done["search"] = db.execute(text(
+        "UPDATE restaurants SET search_vector = to_tsvector('simple', concat_ws(' ', name, description, city))"
+        " WHERE search_vector IS NULL"
+    )).rowcount
+    done["ratings"] = db.execute(text(
+        "UPDATE restaurants r SET rating_count = x.n, rating_sum = x.total, rating_avg = COALESCE(x.total::float / NULLIF(x.n, 0), 0)"
+        " FROM (SELECT r2.id, count(v.id) AS n, COALESCE(sum(v.rating), 0) AS total"
+        "       FROM restaurants r2 LEFT JOIN restaurant_reviews v ON v.restaurant_id = r2.id GROUP BY r2.id) x"
+        " WHERE x.id = r.id AND (r.rating_count <> x.n OR r.rating_sum <> x.total)"
+    )).rowcount
+    cells = db.execute(
+        select(Restaurant.id, Restaurant.latitude, Restaurant.longitude)
+        .where(Restaurant.cell.is_(None), Restaurant.latitude.isnot(None), Restaurant.longitude.isnot(None))
+    ).all()
+    if cells:
+        t = Restaurant.__table__
+        db.execute(
+            update(t).where(t.c.id == bindparam("b_id")).values(cell=bindparam("b_cell")),
+            [{"b_id": rid, "b_cell": cell_id(lat, lon, settings.FOOD_GEO_CELL_DEG)} for rid, lat, lon in cells],
+        )
+    done["cells"] = len(cells)
+    db.commit()
+    done["hours"] = 0
+    while True:
+        rows = db.execute(
+            select(Restaurant.id, Restaurant.hours_json, Restaurant.special_hours_json)
+            .where(Restaurant.has_hours.is_(None)).order_by(Restaurant.id).limit(batch)
+        ).all()
+        sync_hours(db, [r[0] for r in rows], {rid: (h, s) for rid, h, s in rows})
+        db.commit()
+        done["hours"] += len(rows)
+        if len(rows) < batch:
+            return done
+
+
+# --- session hooks --------------------------------------------------------------
+
+
+def _changed(obj, attrs) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+def _before_write(mapper, connection, target: Restaurant) -> None:
+    if target.latitude is not None and target.longitude is not None:
+        target.cell = cell_id(target.latitude, target.longitude, settings.FOOD_GEO_CELL_DEG)
+    else:
+        target.cell = None
+    if inspect(target).pending or _changed(target, _SEARCHED):
+        target.search_vector = _search_vector(target.name, target.description, target.city)
+
+
+def _after_flush(session: Session, flush_context) -> None:
+    hours: Dict[Any, Tuple[Optional[str], Optional[str]]] = {}
+    ratings: Dict[Any, Tuple[int, int]] = {}
+    for obj in session.new:
+        if isinstance(obj, Restaurant):
+            hours[obj.id] = (obj.hours_json, obj.special_hours_json)
+    for obj in session.dirty:
+        if isinstance(obj, Restaurant) and _changed(obj, _HOURS):
+            hours[obj.id] = (obj.hours_json, obj.special_hours_json)
+
+    def bump(rid, n, total):
+        c, s = ratings.get(rid, (0, 0))
+        ratings[rid] = (c + n, s + total)
+
+    for obj in session.new:
+        if isinstance(obj, RestaurantReview):
+            bump(obj.restaurant_id, 1, obj.rating or 0)
+    for obj in session.deleted:
+        if isinstance(obj, RestaurantReview):
+            bump(obj.restaurant_id, -1, -(obj.rating or 0))
+    for obj in session.dirty:
+        if isinstance(obj, RestaurantReview) and _changed(obj, ("rating", "restaurant_id")):
+            state = inspect(obj)
+            old_rating = (state.attrs.rating.history.deleted or [obj.rating])[0]
+            old_rid = (state.attrs.restaurant_id.history.deleted or [obj.restaurant_id])[0]
+            bump(old_rid, -1, -(old_rating or 0))
+            bump(obj.restaurant_id, 1, obj.rating or 0)
+
+    conn = session.connection()
+    if hours:
+        sync_hours(conn, hours.keys(), hours)
+    ratings = {rid: d for rid, d in ratings.items() if d != (0, 0)}
+    if ratings:
+        t = Restaurant.__table__
+        count, total = t.c.rating_count + bindparam("b_n"), t.c.rating_sum + bindparam("b_sum")
+        conn.execute(
+            update(t).where(t.c.id == bindparam("b_id")).values(
+                rating_count=count, rating_sum=total,
+                rating_avg=func.coalesce(cast(total, Float) / func.nullif(count, 0), 0),
+            ),
+            [{"b_id": rid, "b_n": n, "b_sum": s} for rid, (n, s) in ratings.items()],
+        )
+
+
+def install(session_factory) -> None:
+    """Maintain the discovery columns for every session created by ``session_factory``."""
+    for name in ("before_insert", "before_update"):
+        if not event.contains(Restaurant, name, _before_write):
+            event.listen(Restaurant, name, _before_write)
+    if not event.contains(session_factory, "after_flush", _after_flush):
+        event.listen(session_factory, "after_flush", _after_flush)
@@ -0,0 +1,518 @@
+"""Incremental order rollups for operator reporting.
+
+Every flush that inserts, updates or deletes an ``Order`` computes the order's
+contribution before and after the change (counts, revenue, stage durations,
+latency histogram bins) and upserts the difference into hourly and daily
+rollup rows with ``col = col + delta``. Reports read only rollup rows, so
+their cost depends on the window length and number of restaurants, not on
+how many orders exist.
+
+Percentiles come from a log-bucketed histogram (relative error ~2.5%), which
+unlike a plain sample can be added, subtracted and merged across buckets.
+
+``reconcile()`` is the periodic repair job (rows touched by bulk/Core updates
+the flush hook can't see): it upserts only the difference against a recompute
+from ``orders`` and never locks the tables. ``rebuild()`` recomputes a window
+from scratch under a table lock and is meant for backfills.
+"""
+from __future__ import annotations
+
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+from sqlalchemy import and_, event, func, inspect, or_, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..models import (
+    Order,
+    OrderItem,
+    OrderRollupDaily,
+    OrderRollupHourly,
+    OrderRollupItemDaily,
+    OrderRollupLatencyBin,
+    Restaurant,
+)
+
+
+log = logging.getLogger(__name__)
+
+GAMMA = 1.05
+_LOG_GAMMA = math.log(GAMMA)
+
+COUNTERS = (
+    "orders_total",
+    "orders_delivered",
+    "orders_canceled",
+    "gross_cents",
+    "revenue_cents",
+    "accepted_count",
+    "accepted_ms",
+    "prep_count",
+    "prep_ms",
+    "delivery_count",
+    "delivery_ms",
+    "total_count",
+    "total_ms",
+)
+# metric -> (start column, end column)
+STAGES = {
+    "accepted": ("created_at", "accepted_at"),
+    "prep": ("preparing_at", "out_for_delivery_at"),
+    "delivery": ("out_for_delivery_at", "delivered_at"),
+    "total": ("created_at", "delivered_at"),
+}
+TRACKED = ("restaurant_id", "status", "total_cents", "created_at") + tuple(
+    sorted({c for pair in STAGES.values() for c in pair} - {"created_at"})
+)
+
+
+# --- sketch ---------------------------------------------------------------
+
+
+def latency_bin(secs: float) -> int:
+    """Histogram bin for a duration; bin ``i`` covers (GAMMA^(i-1), GAMMA^i] seconds."""
+    if secs <= 1.0:
+        return 0
+    return min(32767, int(math.ceil(math.log(secs) / _LOG_GAMMA)))
+
+
+def bin_value(b: int) -> float:
+    if b <= 0:
+        return 1.0 if b == 0 else 0.0
+    # Midpoint (in relative terms) of the bin's range
+    return 2.0 * GAMMA ** b / (GAMMA + 1.0)
+
+
+def quantile(bins: Mapping[int, int], q: float) -> float:
+    total = sum(c for c in bins.values() if c > 0)
+    if total <= 0:
+        return 0.0
+    rank = q * (total - 1)
+    seen = 0
+    for b in sorted(bins):
+        c = bins[b]
+        if c <= 0:
+            continue
+        seen += c
+        if seen > rank:
+            return bin_value(b)
+    return bin_value(max(bins))
+
+
+# --- contributions --------------------------------------------------------
+
+
+def hour_floor(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def day_floor(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def order_contribution(o: Mapping[str, Any]) -> Tuple[Dict[str, int], Dict[Tuple[str, int], int]]:
+    """Counter values and histogram bins one order adds to its created_at bucket."""
+    c = dict.fromkeys(COUNTERS, 0)
+    bins: Dict[Tuple[str, int], int] = {}
+    total = int(o.get("total_cents") or 0)
+    c["orders_total"] = 1
+    c["gross_cents"] = total
+    if o.get("status") == "delivered":
+        c["orders_delivered"] = 1
+        c["revenue_cents"] = total
+    elif o.get("status") == "canceled":
+        c["orders_canceled"] = 1
+    for metric, (a, b) in STAGES.items():
+        start, end = o.get(a), o.get(b)
+        if start is None or end is None:
+            continue
+        secs = (end - start).total_seconds()
+        c[f"{metric}_count"] = 1
+        c[f"{metric}_ms"] = int(round(secs * 1000))
+        bins[(metric, latency_bin(secs))] = 1
+    return c, bins
+
+
+class Deltas:
+    """Per-flush accumulator keyed by rollup row, so each row is upserted once."""
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, datetime, Any], Dict[str, int]] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self.bins: Dict[Tuple[str, datetime, Any, str, int], int] = defaultdict(int)
+        self.items: Dict[Tuple[datetime, Any, str], int] = defaultdict(int)
+
+    def add_order(self, o: Mapping[str, Any], sign: int) -> None:
+        created = o.get("created_at")
+        rid = o.get("restaurant_id")
+        if created is None or rid is None:
+            return
+        counters, bins = order_contribution(o)
+        for grain, bucket in (("h", hour_floor(created)), ("d", day_floor(created))):
+            row = self.counters[(grain, bucket, rid)]
+            for k, v in counters.items():
+                row[k] += sign * v
+            for (metric, b), n in bins.items():
+                self.bins[(grain, bucket, rid, metric, b)] += sign * n
+
+    def add_item(self, created: datetime, rid: Any, name: str, qty: int) -> None:
+        key = (name or "").strip().lower()[:128]
+        self.items[(day_floor(created), rid, key)] += int(qty or 0)
+
+    def __bool__(self) -> bool:
+        return bool(self.counters or self.items)
+
+
+def _row_order(kv):
+    # Upsert rows in a stable key order so concurrent flushes lock them in the same order
+    return tuple(str(k) for k in kv[0])
+
+
+def apply(conn, d: Deltas) -> None:
+    """Upsert accumulated deltas (``col = col + excluded.col``)."""
+    for grain, model in (("h", OrderRollupHourly), ("d", OrderRollupDaily)):
+        rows = [
+            {"bucket_start": b, "restaurant_id": rid, **vals}
+            for (g, b, rid), vals in sorted(d.counters.items(), key=_row_order)
+            if g == grain and any(vals.values())
+        ]
+        if rows:
+            t = model.__table__
+            stmt = pg_insert(t).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[t.c.bucket_start, t.c.restaurant_id],
+                set_={k: t.c[k] + stmt.excluded[k] for k in COUNTERS},
+            )
+            conn.execute(stmt)
+    bin_rows = [
+        {"grain": g, "bucket_start": b, "restaurant_id": rid, "metric": m, "bin": n, "count": cnt}
+        for (g, b, rid, m, n), cnt in sorted(d.bins.items(), key=_row_order)
+        if cnt
+    ]
+    if bin_rows:
+        t = OrderRollupLatencyBin.__table__
+        stmt = pg_insert(t).values(bin_rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[t.c.grain, t.c.bucket_start, t.c.restaurant_id, t.c.metric, t.c.bin],
+            set_={"count": t.c.count + stmt.excluded.count},
+        )
+        conn.execute(stmt)
+    item_rows = [
+        {"bucket_start": b, "restaurant_id": rid, "item_name": name, "qty": q}
+        for (b, rid, name), q in sorted(d.items.items(), key=_row_order)
+        if q
+    ]
+    if item_rows:
+        t = OrderRollupItemDaily.__table__
+        stmt = pg_insert(t).values(item_rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[t.c.bucket_start, t.c.restaurant_id, t.c.item_name],
+            set_={"qty": t.c.qty + stmt.excluded.qty},
+        )
+        conn.execute(stmt)
+
+
+# --- flush hook -----------------------------------------------------------
+
+
+class _Unknown(Exception):
+    pass
+
+
+def _old_values(state) -> Dict[str, Any]:
+    vals: Dict[str, Any] = {}
+    for attr in TRACKED:
+        hist = state.attrs[attr].history
+        if hist.deleted:
+            vals[attr] = hist.deleted[0]
+        elif hist.unchanged:
+            vals[attr] = hist.unchanged[0]
+        elif not hist.added:
+            # Unchanged and not loaded yet: old value == current value
+            vals[attr] = getattr(state.obj(), attr, None)
+        else:
+            # Attribute was set without its previous value ever being loaded
+            raise _Unknown(attr)
+    return vals
+
+
+def _new_values(obj) -> Dict[str, Any]:
+    return {attr: getattr(obj, attr, None) for attr in TRACKED}
+
+
+def _order_for_item(session: Session, conn, item) -> Optional[Tuple[datetime, Any]]:
+    key = session.identity_key(Order, item.order_id)
+    o = session.identity_map.get(key)
+    if o is not None:
+        return o.created_at, o.restaurant_id
+    row = conn.execute(select(Order.created_at, Order.restaurant_id).where(Order.id == item.order_id)).first()
+    return (row[0], row[1]) if row else None
+
+
+def collect(session: Session) -> Deltas:
+    d = Deltas()
+    conn = None
+    for obj in session.new:
+        if isinstance(obj, Order):
+            d.add_order(_new_values(obj), +1)
+        elif isinstance(obj, OrderItem):
+            conn = conn or session.connection()
+            ref = _order_for_item(session, conn, obj)
+            if ref and ref[0] is not None:
+                d.add_item(ref[0], ref[1], obj.name_snapshot, obj.qty)
+    for obj in session.dirty:
+        if not isinstance(obj, Order):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[a].history.has_changes() for a in TRACKED):
+            continue
+        try:
+            old = _old_values(state)
+        except _Unknown as e:
+            log.warning("rollup: old value of %s unknown for order %s; left to reconcile", e, obj.id)
+            continue
+        d.add_order(old, -1)
+        d.add_order(_new_values(obj), +1)
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            try:
+                d.add_order(_old_values(inspect(obj)), -1)
+            except _Unknown:
+                continue
+        elif isinstance(obj, OrderItem):
+            conn = conn or session.connection()
+            ref = _order_for_item(session, conn, obj)
+            if ref and ref[0] is not None:
+                d.add_item(ref[0], ref[1], obj.name_snapshot, -int(obj.qty or 0))
+    return d
+
+
+def _after_flush(session: Session, flush_context) -> None:
+    d = collect(session)
+    if d:
+        apply(session.connection(), d)
+
+
+def install(session_factory) -> None:
+    """Maintain rollups for every session created by ``session_factory``."""
+    if not event.contains(session_factory, "after_flush", _after_flush):
+        event.listen(session_factory, "after_flush", _after_flush)
+
+
+# --- rebuild --------------------------------------------------------------
+
+_ROLLUP_TABLES = (
+    OrderRollupHourly.__table__,
+    OrderRollupDaily.__table__,
+    OrderRollupLatencyBin.__table__,
+    OrderRollupItemDaily.__table__,
+)
+
+
+def _recompute(conn, since: datetime, until: Optional[datetime], chunk: int) -> Tuple[Deltas, int]:
+    """Rollup rows for orders created in [since, until), built from ``orders``."""
+    cols = [getattr(Order, a) for a in TRACKED]
+    q = select(*cols).where(Order.created_at >= since)
+    if until is not None:
+        q = q.where(Order.created_at < until)
+    d = Deltas()
+    n = 0
+    for row in conn.execute(q.execution_options(yield_per=chunk)):
+        d.add_order(dict(zip(TRACKED, row)), +1)
+        n += 1
+    iq = (
+        select(Order.created_at, Order.restaurant_id, OrderItem.name_snapshot, func.sum(OrderItem.qty))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.created_at >= since)
+        .group_by(Order.created_at, Order.restaurant_id, OrderItem.name_snapshot)
+    )
+    if until is not None:
+        iq = iq.where(Order.created_at < until)
+    for created, rid, name, qty in conn.execute(iq):
+        d.add_item(created, rid, name, int(qty or 0))
+    return d, n
+
+
+def _window(t, since: datetime, until: Optional[datetime]):
+    q = select(t).where(t.c.bucket_start >= since)
+    return q.where(t.c.bucket_start < until) if until is not None else q
+
+
+def _subtract_stored(conn, d: Deltas, since: datetime, until: Optional[datetime]) -> None:
+    """Subtract the rollup rows currently stored for the window, leaving only the drift in ``d``."""
+    for grain, model in (("h", OrderRollupHourly), ("d", OrderRollupDaily)):
+        for r in conn.execute(_window(model.__table__, since, until)).mappings():
+            row = d.counters[(grain, r["bucket_start"], r["restaurant_id"])]
+            for k in COUNTERS:
+                row[k] -= int(r[k] or 0)
+    for r in conn.execute(_window(OrderRollupLatencyBin.__table__, since, until)).mappings():
+        d.bins[(r["grain"], r["bucket_start"], r["restaurant_id"], r["metric"], r["bin"])] -= int(r["count"] or 0)
+    for r in conn.execute(_window(OrderRollupItemDaily.__table__, since, until)).mappings():
+        d.items[(r["bucket_start"], r["restaurant_id"], r["item_name"])] -= int(r["qty"] or 0)
+
+
+def rebuild(db: Session, since: datetime, until: Optional[datetime] = None, chunk: int = 5000) -> int:
+    """Recompute rollups for orders created in [day_floor(since), until) from scratch.
+
+    Takes SHARE ROW EXCLUSIVE on the rollup tables: writers that already
+    upserted deltas finish first, new writers wait until the rebuild commits,
+    so no delta is lost or double counted. Returns the number of orders read.
+    Meant for backfills; the periodic repair is ``reconcile()``.
+    """
+    since = day_floor(since)
+    until = day_floor(until) + timedelta(days=1) if until is not None else None
+    conn = db.connection()
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(
+            "LOCK TABLE " + ", ".join(t.name for t in _ROLLUP_TABLES) + " IN SHARE ROW EXCLUSIVE MODE"
+        )
+    for t in _ROLLUP_TABLES:
+        q = t.delete().where(t.c.bucket_start >= since)
+        if until is not None:
+            q = q.where(t.c.bucket_start < until)
+        conn.execute(q)
+    d, n = _recompute(conn, since, until, chunk)
+    apply(conn, d)
+    return n
+
+
+def reconcile(bind, since: datetime, until: Optional[datetime] = None, chunk: int = 5000) -> int:
+    """Repair drift in the rollups of [day_floor(since), until) without blocking order writes.
+
+    Orders and stored rollups are read in one REPEATABLE READ snapshot, in
+    which every committed order's delta is either fully visible or not at
+    all, so ``expected - stored`` is exactly the drift. That difference is
+    then upserted as an ordinary delta (``col = col + delta``) in a separate
+    short transaction: only the drifted rows are locked, and deltas committed
+    after the snapshot stay on top of the repair. Returns the number of rows
+    corrected.
+    """
+    since = day_floor(since)
+    until = day_floor(until) + timedelta(days=1) if until is not None else None
+    with bind.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        with conn.begin():
+            d, _ = _recompute(conn, since, until, chunk)
+            _subtract_stored(conn, d, since, until)
+    drift = Deltas()
+    drift.counters.update((k, v) for k, v in d.counters.items() if any(v.values()))
+    drift.bins.update((k, v) for k, v in d.bins.items() if v)
+    drift.items.update((k, v) for k, v in d.items.items() if v)
+    fixed = len(drift.counters) + len(drift.bins) + len(drift.items)
+    if fixed:
+        with bind.begin() as conn:
+            apply(conn, drift)
+        log.warning("rollup: reconcile corrected %d rows since %s", fixed, since.isoformat())
+    return fixed
+
+
+# --- report queries -------------------------------------------------------
+
+
+def window(days: int, max_days: int, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """Report window ``[fr, to]``; ``fr`` is aligned to the hour (rollup grain)."""
+    to = now or datetime.utcnow()
+    fr = hour_floor(to - timedelta(days=max(1, min(days, max_days))))
+    return fr, to
+
+
+def _split(fr: datetime, to: datetime):
+    """Hourly ranges at the window edges plus the whole-day range in between."""
+    first_day = fr if fr == day_floor(fr) else day_floor(fr) + timedelta(days=1)
+    last_day = day_floor(to)
+    if first_day >= last_day:
+        return [(fr, to)], None
+    return [(fr, first_day), (last_day, to)], (first_day, last_day)
+
+
+def _counter_source(fr: datetime, to: datetime):
+    """Union of hourly edge rows and daily rows covering [fr, to]."""
+    hours, days = _split(fr, to)
+    H, D = OrderRollupHourly.__table__, OrderRollupDaily.__table__
+    parts = [select(H).where(_hour_cond(H.c.bucket_start, hours, to))]
+    if days:
+        parts.append(select(D).where(D.c.bucket_start >= days[0], D.c.bucket_start < days[1]))
+    return union_all(*parts).subquery("r")
+
+
+def _hour_cond(col, hours, to):
+    conds = []
+    for a, b in hours:
+        # The trailing range ends "now": include the current, partial hour
+        conds.append(and_(col >= a, col <= b) if b == to else and_(col >= a, col < b))
+    return or_(*conds)
+
+
+def totals(db: Session, fr: datetime, to: datetime, by: Optional[str] = None):
+    """Summed counters over the window; ``by`` = None | "restaurant" | "city"."""
+    r = _counter_source(fr, to)
+    sums = [func.coalesce(func.sum(r.c[k]), 0).label(k) for k in COUNTERS]
+    if by is None:
+        row = db.execute(select(*sums)).one()
+        return {k: int(getattr(row, k)) for k in COUNTERS}
+    if by == "restaurant":
+        keys = [Restaurant.id.label("restaurant_id"), Restaurant.name.label("restaurant_name")]
+    elif by == "city":
+        keys = [Restaurant.city.label("city")]
+    else:
+        raise ValueError(by)
+    q = select(*keys, *sums).join(Restaurant, Restaurant.id == r.c.restaurant_id).group_by(*keys)
+    return db.execute(q).all()
+
+
+def latency(db: Session, fr: datetime, to: datetime) -> Dict[str, Dict[int, int]]:
+    hours, days = _split(fr, to)
+    B = OrderRollupLatencyBin.__table__
+    cond = (B.c.grain == "h") & _hour_cond(B.c.bucket_start, hours, to)
+    if days:
+        cond = cond | ((B.c.grain == "d") & (B.c.bucket_start >= days[0]) & (B.c.bucket_start < days[1]))
+    q = select(B.c.metric, B.c.bin, func.sum(B.c.count)).where(cond).group_by(B.c.metric, B.c.bin)
+    out: Dict[str, Dict[int, int]] = {m: {} for m in STAGES}
+    for metric, b, cnt in db.execute(q):
+        out.setdefault(metric, {})[int(b)] = int(cnt or 0)
+    return out
+
+
+def peaks(db: Session, fr: datetime, to: datetime) -> Tuple[Dict[int, int], Dict[int, int]]:
+    """Orders by hour of day and weekday (Mon=0), from hourly rows."""
+    H = OrderRollupHourly.__table__
+    hour = func.extract("hour", H.c.bucket_start)
+    dow = func.extract("isodow", H.c.bucket_start)
+    q = (
+        select(hour, dow, func.sum(H.c.orders_total))
+        .where(H.c.bucket_start >= fr, H.c.bucket_start <= to)
+        .group_by(hour, dow)
+    )
+    by_hour: Dict[int, int] = defaultdict(int)
+    by_dow: Dict[int, int] = defaultdict(int)
+    for h, w, n in db.execute(q):
+        by_hour[int(h)] += int(n or 0)
+        by_dow[int(w) - 1] += int(n or 0)
+    return by_hour, by_dow
+
+
+def top_items(db: Session, fr: datetime, to: datetime, limit: int) -> Iterable[Tuple[str, int]]:
+    """Top items by quantity; item rollups are daily, so ``fr`` is widened to its day."""
+    t = OrderRollupItemDaily.__table__
+    qty = func.sum(t.c.qty)
+    q = (
+        select(t.c.item_name, qty)
+        .where(t.c.bucket_start >= day_floor(fr), t.c.bucket_start <= to)
+        .group_by(t.c.item_name)
+        .having(qty > 0)
+        .order_by(qty.desc(), t.c.item_name)
+        .limit(limit)
+    )
+    return [(name, int(n)) for name, n in db.execute(q)]
+
+
+def stage_stats(count: int, total_ms: int, bins: Mapping[int, int]) -> dict:
+    return {
+        "count": int(count),
+        "avg_secs": (total_ms / 1000.0 / count) if count else 0,
+        "p50_secs": quantile(bins, 0.5) if count else 0,
+        "p90_secs": quantile(bins, 0.9) if count else 0,
+    }
+
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Benchmark the restaurant listing (app.utils.discovery).
+
+Usage:
+  DB_URL=postgresql+psycopg2://... python apps/food/scripts/bench_discovery.py \
+      [--restaurants 50000] [--reviews 6] [--repeat 10] [--depth 100] [--skip-seed]
+
+Seeds ``--restaurants`` restaurants around a dozen cities, with coordinates,
+weekly hours (some past midnight, some with a special day today, a few
+forced open or closed) and ``--reviews`` reviews each on average, then:
+
+* fills ratings, search terms, grid cells and ``restaurant_hours`` with
+  ``discovery.backfill`` (bulk-inserted rows skip the flush hooks, as a
+  migration of old rows would);
+* counts queries and times pages of 20, 50 and 100, page ``--depth`` and a
+  few filter mixes against the previous listing loop (a rating aggregate
+  and a JSON parse per row, ``q`` filtered in Python after the LIMIT);
+* checks that both agree on ``is_open`` and ratings for the first page, and
+  that walking every page of one city by cursor returns each restaurant
+  exactly once.
+
+Seeded rows are left in place; use a scratch database (``--skip-seed``
+re-runs the timings on it).
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+from sqlalchemy import event, func, insert, select, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs", "superapp_shared"))
+
+if not os.getenv("DB_URL"):
+    print("Set DB_URL env to point to a scratch food database", file=sys.stderr)
+    sys.exit(2)
+
+from app.database import SessionLocal, engine  # type: ignore  # noqa: E402
+from app import main as _service  # type: ignore  # noqa: E402,F401  (creates the schema, columns and indexes as the service does)
+from app.models import Restaurant, RestaurantHours, RestaurantReview, User  # type: ignore  # noqa: E402
+from app.utils import discovery  # type: ignore  # noqa: E402
+
+CITIES = {
+    "Damascus": (33.513, 36.292), "Aleppo": (36.202, 37.134), "Homs": (34.733, 36.717), "Hama": (35.132, 36.757),
+    "Latakia": (35.523, 35.791), "Tartus": (34.889, 35.887), "Deir ez-Zor": (35.336, 40.141), "Raqqa": (35.950, 39.009),
+    "Idlib": (35.931, 36.632), "Daraa": (32.625, 36.106), "As-Suwayda": (32.709, 36.566), "Qamishli": (37.052, 41.231),
+}
+KINDS = ["Grill", "Shawarma", "Falafel", "Bakery", "Sweets", "Pizza", "Burger", "Kitchen", "Cafe", "Seafood", "Mezze", "Juice"]
+NAMES = ["Al Sham", "Bab Touma", "Jasmine", "Orontes", "Citadel", "Olive Tree", "Barada", "Umayyad", "Souq", "Cedar", "Levant", "Golden"]
+
+
+def _hm(minute: int) -> str:
+    return f"{minute // 60 % 24:02d}:{minute % 60:02d}"
+
+
+def _hours(rnd: random.Random, today: dt.date):
+    """(hours_json, special_hours_json, is_open_override) as operators fill them in."""
+    if rnd.random() < 0.08:
+        return None, None, None
+    hours = {}
+    for day in discovery.WEEKDAYS:
+        if rnd.random() < 0.1:
+            continue
+        opens = rnd.choice((7, 8, 9, 10, 11, 12)) * 60
+        closes = rnd.choice((15, 21, 22, 23, 24, 25, 26)) * 60
+        if closes == 15 * 60:
+            hours[day] = [[_hm(opens), "15:00"], ["17:00", "23:00"]]
+        else:
+            hours[day] = [[_hm(opens), _hm(closes) if closes < 24 * 60 else ("24:00" if closes == 24 * 60 else _hm(closes))]]
+    specials = None
+    if rnd.random() < 0.05:
+        specials = {today.isoformat(): rnd.choice(("closed", [["10:00", "14:00"]]))}
+    override = rnd.choice((True, False)) if rnd.random() < 0.02 else None
+    return json.dumps(hours), json.dumps(specials) if specials else None, override
+
+
+def _seed(rnd: random.Random, n_restaurants: int, reviews_per_restaurant: float, n_users: int = 2000) -> None:
+    now = dt.datetime.utcnow()
+    today = now.date()
+    with engine.begin() as conn:
+        users = [{"id": uuid.uuid4(), "phone": f"bench-{uuid.uuid4().hex[:20]}", "twofa_enabled": False, "created_at": now} for _ in range(n_users)]
+        conn.execute(insert(User.__table__), users)
+        for start in range(0, n_restaurants, 5000):
+            restaurants, reviews = [], []
+            for i in range(start, min(n_restaurants, start + 5000)):
+                rid = uuid.uuid4()
+                city = rnd.choice(list(CITIES))
+                lat, lon = CITIES[city]
+                hours, specials, override = _hours(rnd, today)
+                restaurants.append({
+                    "id": rid, "name": f"{rnd.choice(NAMES)} {rnd.choice(KINDS)} {i}", "city": city,
+                    "description": f"{rnd.choice(KINDS)} and {rnd.choice(KINDS).lower()} in {city}",
+                    "latitude": lat + rnd.gauss(0, 0.06), "longitude": lon + rnd.gauss(0, 0.06),
+                    "hours_json": hours, "special_hours_json": specials, "is_open_override": override,
+                    "busy_mode": False, "created_at": now - dt.timedelta(seconds=n_restaurants - i),
+                })
+                for _ in range(int(rnd.expovariate(1 / reviews_per_restaurant)) if reviews_per_restaurant else 0):
+                    reviews.append({
+                        "id": uuid.uuid4(), "restaurant_id": rid, "user_id": rnd.choice(users)["id"],
+                        "rating": rnd.choices((1, 2, 3, 4, 5), (5, 5, 15, 35, 40))[0], "created_at": now,
+                    })
+            conn.execute(insert(Restaurant.__table__), restaurants)
+            if reviews:
+                conn.execute(insert(RestaurantReview.__table__), reviews)
+
+
+def _legacy_is_open(hours, override, specials, now):
+    """``_compute_is_open`` of the previous listing, with ``now`` passed in."""
+    if override is not None:
+        return bool(override)
+    if not hours:
+        return None
+    try:
+        if specials:
+            key = now.strftime("%Y-%m-%d")
+            if key in specials:
+                slots = specials.get(key) or []
+                if slots in ([], None, "closed"):
+                    return False
+                hm = now.hour * 60 + now.minute
+                for a, b in slots:
+                    ah, am = map(int, str(a).split(":"))
+                    bh, bm = map(int, str(b).split(":"))
+                    if (ah * 60 + am) <= hm <= (bh * 60 + bm):
+                        return True
+                return False
+        slots = hours.get(discovery.WEEKDAYS[now.weekday()]) or []
+        hm = now.hour * 60 + now.minute
+        for a, b in slots:
+            ah, am = map(int, str(a).split(":"))
+            bh, bm = map(int, str(b).split(":"))
+            if (ah * 60 + am) <= hm <= (bh * 60 + bm):
+                return True
+        return False
+    except Exception:
+        return None
+
+
+def _legacy(db, now, city=None, q=None, limit=50, offset=0):
+    """The listing before discovery: a page by OFFSET, then an aggregate query and JSON parsing per restaurant."""
+    db.query(Restaurant).count()  # dev seeding check
+    query = db.query(Restaurant)
+    if city:
+        query = query.filter(Restaurant.city == city)
+    out = []
+    for r in query.order_by(Restaurant.created_at.desc()).limit(limit).offset(offset).all():
+        if q and q.lower() not in ((r.name or "") + " " + (r.description or "")).lower():
+            continue
+        avg, cnt = db.query(func.avg(RestaurantReview.rating), func.count(RestaurantReview.id)).filter(RestaurantReview.restaurant_id == r.id).one()
+        hours = json.loads(r.hours_json) if r.hours_json else None
+        specials = json.loads(r.special_hours_json) if r.special_hours_json else None
+        out.append((r.id, float(avg) if avg is not None else None, int(cnt), _legacy_is_open(hours, r.is_open_override, specials, now)))
+    return out
+
+
+def _past_midnight(hours_json, now) -> bool:
+    """Whether yesterday's hours run into today."""
+    hours = json.loads(hours_json or "{}")
+    yesterday = discovery.WEEKDAYS[(now.weekday() - 1) % 7]
+    return any(discovery._minute(a) > discovery._minute(b) for a, b in hours.get(yesterday) or [])
+
+
+@contextmanager
+def _queries():
+    seen = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        yield seen
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+
+def _ms(fn, repeat: int):
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(out)
+
+
+def _new(db, at, **kw):
+    kw.setdefault("now", at)
+
+    def run():
+        rows, cursor = discovery.page(db, **kw)
+        db.expunge_all()
+        return rows, cursor
+    return run
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--restaurants", type=int, default=50_000)
+    ap.add_argument("--reviews", type=float, default=6.0, help="average reviews per restaurant")
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--depth", type=int, default=100, help="page number (of 50) for the deep-page timings")
+    ap.add_argument("--skip-seed", action="store_true", help="reuse the rows of a previous run")
+    args = ap.parse_args()
+
+    rnd = random.Random(50)
+    t0 = time.perf_counter()
+    if not args.skip_seed:
+        _seed(rnd, args.restaurants, args.reviews)
+    with engine.begin() as conn:
+        counts = [conn.execute(select(func.count()).select_from(t)).scalar() for t in (Restaurant.__table__, RestaurantReview.__table__)]
+    print(f"seeded  : {counts[0]:,} restaurants, {counts[1]:,} reviews in {time.perf_counter() - t0:.1f}s", flush=True)
+
+    with SessionLocal() as db:
+        t0 = time.perf_counter()
+        done = discovery.backfill(db)
+        print(f"backfill: {', '.join(f'{v:,} {k}' for k, v in done.items())} in {time.perf_counter() - t0:.1f}s", flush=True)
+    with engine.begin() as conn:
+        for t in ("restaurants", "restaurant_reviews", "restaurant_hours"):
+            conn.execute(text(f"ANALYZE {t}"))
+        hours_rows = conn.execute(select(func.count()).select_from(RestaurantHours.__table__)).scalar()
+    print(f"hours   : {hours_rows:,} interval rows", flush=True)
+
+    now = dt.datetime.utcnow()
+    with SessionLocal() as db:
+        # Same ratings and is_open as the previous loop for the first page
+        legacy = _legacy(db, now, limit=100)
+        rows, _ = _new(db, now, limit=100)()
+        assert [x[0] for x in legacy] == [uuid.UUID(r.id) for r in rows]
+        overnight = 0
+        for (rid, avg, cnt, is_open), r in zip(legacy, rows):
+            assert cnt == r.rating_count and (avg is None) == (r.rating_avg is None), (rid, avg, cnt, r)
+            assert avg is None or abs(avg - r.rating_avg) < 1e-9
+            if is_open != r.is_open:
+                # The previous loop never opened intervals past midnight ("22:00"-"01:00")
+                assert (is_open, r.is_open) == (False, True) and _past_midnight(db.get(Restaurant, rid).hours_json, now), (rid, is_open, r)
+                overnight += 1
+        print(f"check   : first 100 agree on ratings and is_open ({overnight} now open past midnight)", flush=True)
+
+        cursor, depth = None, 1
+        while depth < args.depth:
+            cursor = _new(db, now, limit=50, cursor=cursor)()[1]
+            depth += 1
+        home = CITIES["Damascus"]
+        cases = [
+            ("newest, 20", dict(limit=20), dict(limit=20)),
+            ("newest, 50", dict(limit=50), dict(limit=50)),
+            ("newest, 100", dict(limit=100), dict(limit=100)),
+            (f"newest, page {args.depth}", dict(offset=(args.depth - 1) * 50), dict(cursor=cursor)),
+            ("city", dict(city="Homs"), dict(city="Homs")),
+            ("q text", dict(q="citadel"), dict(q="citadel")),
+            ("q two words", dict(q="jasmine bakery"), dict(q="jasmine bake")),
+            ("open now, 06:30", None, dict(open_now=True, now=now.replace(hour=6, minute=30))),
+            ("open now, 13:00", None, dict(open_now=True, now=now.replace(hour=13, minute=0))),
+            ("best rated", None, dict(sort="rating")),
+            ("near, 3 km", None, dict(lat=home[0], lon=home[1], radius_km=3)),
+            ("near, 10 km open", None, dict(lat=home[0], lon=home[1], radius_km=10, open_now=True)),
+        ]
+        print(f"{'case':<22}{'legacy':>10}{'queries':>9}{'rows':>6}{'new':>10}{'queries':>9}{'rows':>6}  (medians)")
+        for name, old_kw, new_kw in cases:
+            legacy_cols = f"{'-':>10}{'-':>9}{'-':>6}"
+            if old_kw is not None:
+                with _queries() as seen:
+                    found = _legacy(db, now, **old_kw)
+                db.expunge_all()
+                t_old = _ms(lambda: (_legacy(db, now, **old_kw), db.expunge_all()), args.repeat)
+                legacy_cols = f"{t_old:>8.1f}ms{len(seen):>9}{len(found):>6}"
+            with _queries() as seen:
+                rows, _ = _new(db, now, **new_kw)()
+            t_new = _ms(_new(db, now, **new_kw), args.repeat)
+            print(f"{name:<22}{legacy_cols}{t_new:>8.1f}ms{len(seen):>9}{len(rows):>6}", flush=True)
+
+        # Every restaurant of one city exactly once across all cursor pages
+        total = db.execute(select(func.count()).select_from(Restaurant).where(Restaurant.city == "Aleppo")).scalar()
+        seen_ids, cursor, pages = [], None, 0
+        t0 = time.perf_counter()
+        while True:
+            rows, cursor = _new(db, now, city="Aleppo", sort="rating", limit=100, cursor=cursor)()
+            seen_ids += [r.id for r in rows]
+            pages += 1
+            if not cursor:
+                break
+        assert len(seen_ids) == len(set(seen_ids)) == total, (len(seen_ids), len(set(seen_ids)), total)
+        print(f"walk    : {total:,} restaurants of one city by rating in {pages} pages, {(time.perf_counter() - t0) / pages * 1000:.1f} ms per page, none repeated or missed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Bid awards and reverse auctions.
+
+A load is awarded by one conditional UPDATE on the load row (``posted`` to
+``assigned``). Concurrent attempts all race on that row: two shipper sessions
+accepting different bids, the auction sweeper, or a carrier taking the load
+directly. Exactly one wins and the rest get ``AwardConflict``. In the same
+transaction one UPDATE marks the winning bid ``accepted`` and every other
+pending bid on the load ``rejected``, and each change is written to
+``bid_events`` (the bid history). A partial unique index on accepted bids
+per load backs this up.
+
+Locks are always taken load first, then bids, so awards, bid placement and
+withdrawals queue behind each other instead of deadlocking. Bid placement
+holds a share lock on the load, so a bid placed during an award sees the
+load taken rather than staying pending afterwards.
+
+Reverse auctions: a load posted with ``bid_deadline`` (and optionally
+``reserve_cents``) takes bids until the deadline. A carrier keeps one live
+bid per load and can only lower it, and bids above the reserve are refused.
+The shipper may still accept a bid early. Once the deadline passes, the
+lowest bid wins (on ties, the one that got there first). The award is made
+by ``close_due`` (the ``freight_auction_close`` job), or by ``close_if_due``
+when someone looks at an overdue auction. An auction without bids ends ``unsold``, and the load
+stays posted for direct acceptance.
+
+All times are naive UTC, like the rest of the service.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, func, insert, select, true, update
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Bid, BidEvent, Load
+from .utils.notify import notify
+
+
+class AuctionError(Exception):
+    """A bid or award request that cannot be carried out; ``status_code`` is the HTTP status to answer with."""
+
+    status_code = 400
+
+    def __init__(self, detail: str, status_code: Optional[int] = None):
+        super().__init__(detail)
+        self.detail = detail
+        if status_code is not None:
+            self.status_code = status_code
+
+
+class AwardConflict(AuctionError):
+    """The load was awarded or taken by someone else, or the bid is no longer pending."""
+
+    status_code = 409
+
+
+# (bid_id, carrier_id, amount_cents, status) of bids changed by one statement
+_Changed = Tuple[object, object, int, str]
+
+
+def _record(db: Session, load_id, rows: Sequence[_Changed], event: Optional[str], actor: str, now: datetime) -> None:
+    """Append history rows; ``event`` None takes each row's new status as the event."""
+    if rows:
+        db.execute(insert(BidEvent.__table__), [
+            {"bid_id": bid_id, "load_id": load_id, "carrier_id": cid, "event": event or st, "amount_cents": amount, "actor": actor, "created_at": now}
+            for bid_id, cid, amount, st in rows
+        ])
+
+
+def _settle_pending(db: Session, load_id, winner_id, actor: str, now: datetime) -> List[_Changed]:
+    """One UPDATE: the winner (if any) accepted, every other pending bid on the load rejected."""
+    status = case((Bid.id == winner_id, "accepted"), else_="rejected") if winner_id is not None else "rejected"
+    rows = db.execute(
+        update(Bid)
+        .where(Bid.load_id == load_id, Bid.status == "pending")
+        .values(status=status, updated_at=now)
+        .returning(Bid.id, Bid.carrier_id, Bid.amount_cents, Bid.status)
+        .execution_options(synchronize_session=False)
+    ).all()
+    rows = [tuple(r) for r in rows]
+    _record(db, load_id, rows, None, actor, now)
+    return rows
+
+
+def open_auction(load: Load, bid_deadline: datetime, reserve_cents: Optional[int], now: Optional[datetime] = None) -> None:
+    """Make a new load a reverse auction closing at ``bid_deadline``."""
+    now = now or datetime.utcnow()
+    if bid_deadline.tzinfo is not None:
+        bid_deadline = (bid_deadline - bid_deadline.utcoffset()).replace(tzinfo=None)
+    if bid_deadline <= now:
+        raise AuctionError("Bid deadline must be in the future")
+    if bid_deadline > now + timedelta(days=settings.FREIGHT_AUCTION_MAX_DAYS):
+        raise AuctionError(f"Bid deadline must be within {settings.FREIGHT_AUCTION_MAX_DAYS} days")
+    load.auction_status = "open"
+    load.bid_deadline = bid_deadline
+    load.reserve_cents = reserve_cents
+
+
+def place_bid(db: Session, load_id, carrier_id, amount_cents: int, now: Optional[datetime] = None) -> Bid:
+    """Place the carrier's bid on a posted load, or revise its pending one; the caller commits."""
+    now = now or datetime.utcnow()
+    # Share lock: bidders do not block each other, but an award waits for them (and they for it)
+    load = db.execute(select(Load).where(Load.id == load_id).with_for_update(read=True)).scalars().first()
+    if load is None or load.status != "posted":
+        raise AuctionError("Load not available", 404)
+    auction = load.auction_status == "open"
+    if auction and now >= load.bid_deadline:
+        raise AuctionError("Bidding closed")
+    if auction and load.reserve_cents is not None and amount_cents > load.reserve_cents:
+        raise AuctionError("Bid above reserve")
+    bid = db.execute(
+        select(Bid).where(Bid.load_id == load.id, Bid.carrier_id == carrier_id, Bid.status == "pending").with_for_update()
+    ).scalars().first()
+    if bid is None:
+        bid = Bid(load_id=load.id, carrier_id=carrier_id, amount_cents=amount_cents, status="pending", created_at=now)
+        db.add(bid)
+        db.flush()
+        _record(db, load.id, [(bid.id, carrier_id, amount_cents, "pending")], "placed", "carrier", now)
+        return bid
+    if auction and amount_cents >= bid.amount_cents:
+        raise AuctionError("A revised bid must be lower")
+    bid.amount_cents = amount_cents
+    bid.updated_at = now
+    db.flush()
+    _record(db, load.id, [(bid.id, carrier_id, amount_cents, "pending")], "revised", "carrier", now)
+    return bid
+
+
+def award(db: Session, bid: Bid, actor: str = "shipper", now: Optional[datetime] = None) -> Tuple[Load, List[_Changed]]:
+    """Award the bid's load to it and reject the other pending bids; raises ``AwardConflict``. The caller commits.
+
+    Returns the load and the bids changed, winner included.
+    """
+    now = now or datetime.utcnow()
+    won = db.execute(
+        update(Load)
+        .where(Load.id == bid.load_id, Load.status == "posted")
+        .values(
+            status="assigned", carrier_id=bid.carrier_id, awarded_bid_id=bid.id, awarded_at=now,
+            auction_status=case((Load.auction_status.is_(None), None), else_="awarded"),
+        )
+        .returning(Load.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if won is None:
+        raise AwardConflict("Load already awarded")
+    rows = _settle_pending(db, bid.load_id, bid.id, actor, now)
+    winner = next((r for r in rows if r[0] == bid.id), None)
+    if winner is None:
+        # Withdrawn or rejected while we waited for the load; the caller rolls back the award
+        raise AwardConflict("Bid no longer pending")
+    db.execute(update(Load).where(Load.id == bid.load_id).values(price_cents=winner[2]).execution_options(synchronize_session=False))
+    load = db.execute(select(Load).where(Load.id == bid.load_id).execution_options(populate_existing=True)).scalar_one()
+    db.refresh(bid)
+    return load, rows
+
+
+def take(db: Session, load_id, carrier_id, now: Optional[datetime] = None) -> Tuple[Load, List[_Changed]]:
+    """A carrier accepts a posted load at its listed price; pending bids on it are rejected. Not for open auctions."""
+    now = now or datetime.utcnow()
+    won = db.execute(
+        update(Load)
+        .where(Load.id == load_id, Load.status == "posted", Load.auction_status.is_distinct_from("open"))
+        .values(status="assigned", carrier_id=carrier_id, awarded_at=now)
+        .returning(Load.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if won is None:
+        load = db.get(Load, load_id)
+        if load is not None and load.status == "posted":
+            raise AuctionError("Load is in an auction; place a bid")
+        raise AwardConflict("Not available")
+    rows = _settle_pending(db, load_id, None, "system", now)
+    return db.execute(select(Load).where(Load.id == load_id).execution_options(populate_existing=True)).scalar_one(), rows
+
+
+def set_bid_status(db: Session, bid: Bid, status: str, actor: str, now: Optional[datetime] = None) -> bool:
+    """Reject (shipper) or cancel (carrier) a pending bid; False if it was no longer pending."""
+    now = now or datetime.utcnow()
+    row = db.execute(
+        update(Bid)
+        .where(Bid.id == bid.id, Bid.status == "pending")
+        .values(status=status, updated_at=now)
+        .returning(Bid.id, Bid.carrier_id, Bid.amount_cents, Bid.status)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return False
+    _record(db, bid.load_id, [tuple(row)], None, actor, now)
+    db.refresh(bid)
+    return True
+
+
+def best_bid(db: Session, load: Load) -> Optional[Bid]:
+    q = select(Bid).where(Bid.load_id == load.id, Bid.status == "pending")
+    if load.reserve_cents is not None:
+        q = q.where(Bid.amount_cents <= load.reserve_cents)
+    # Ties go to whoever reached the amount first
+    return db.execute(q.order_by(Bid.amount_cents, func.coalesce(Bid.updated_at, Bid.created_at), Bid.id).limit(1)).scalars().first()
+
+
+def _close(db: Session, load: Load, now: datetime) -> Optional[List[_Changed]]:
+    """Close a locked, overdue auction: award the best bid or mark it unsold.
+
+    Returns the bids changed, None if unsold, or [] if every pick was withdrawn under us (left open for the next sweep).
+    """
+    for _ in range(3):
+        bid = best_bid(db, load)
+        if bid is None:
+            load.auction_status = "unsold"
+            db.flush()
+            return None
+        try:
+            with db.begin_nested():
+                _, rows = award(db, bid, actor="system", now=now)
+            return rows
+        except AwardConflict:
+            continue
+    return []
+
+
+def notify_award(load: Load, rows: Sequence[_Changed]) -> None:
+    """``bid.accepted`` to the winner and ``bid.rejected`` to the others; call after commit."""
+    for bid_id, cid, amount, st in rows:
+        notify(f"bid.{st}", {"bid_id": str(bid_id), "load_id": str(load.id), "carrier_id": str(cid), "amount_cents": amount, "auction": load.auction_status is not None})
+
+
+def close_if_due(db: Session, load: Load, now: Optional[datetime] = None) -> bool:
+    """Close the load's auction now if its deadline passed and no one else is closing it; commits."""
+    now = now or datetime.utcnow()
+    if load.auction_status != "open" or load.bid_deadline is None or load.bid_deadline > now:
+        return False
+    locked = db.execute(
+        select(Load).where(Load.id == load.id, Load.auction_status == "open", Load.status == "posted")
+        .with_for_update(skip_locked=True).execution_options(populate_existing=True)
+    ).scalars().first()
+    if locked is None:
+        return False
+    rows = _close(db, locked, now)
+    db.commit()
+    if rows:
+        notify_award(locked, rows)
+    return rows != []
+
+
+def close_due(db: Session, now: Optional[datetime] = None, batch: int = 100, where=None) -> Dict[str, int]:
+    """Close every open auction past its deadline; commits per load. Returns counts by outcome."""
+    now = now or datetime.utcnow()
+    out = {"awarded": 0, "unsold": 0, "retry": 0}
+    while True:
+        due = db.execute(
+            select(Load)
+            .where(Load.auction_status == "open", Load.status == "posted", Load.bid_deadline <= now, where if where is not None else true())
+            .order_by(Load.bid_deadline)
+            .limit(batch)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        done = []
+        for load in due:
+            rows = _close(db, load, now)
+            out["awarded" if rows else "unsold" if rows is None else "retry"] += 1
+            done.append((load.id, rows))
+        db.commit()
+        for load_id, rows in done:
+            if rows:
+                notify_award(db.get(Load, load_id), rows)
+        if len(due) < batch:
+            return out
@@ -33,6 +33,24 @@ class Settings:
     OTP_TTL_SECS: int = int(os.getenv("OTP_TTL_SECS", "300"))
     OTP_MAX_ATTEMPTS: int = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
     DEV_DISABLE_OTP: bool = env_bool("DEV_DISABLE_OTP", default=False)
+    NOTIFY_MODE: str = os.getenv("NOTIFY_MODE", "log")  # log|redis
+    NOTIFY_REDIS_CHANNEL: str = os.getenv("NOTIFY_REDIS_CHANNEL", "freight.events")
+    # Load matching: origins indexed on a FREIGHT_CELL_DEG grid; distances are straight line x FREIGHT_ROAD_FACTOR
+    FREIGHT_GAZETTEER_PATH: str = os.getenv("FREIGHT_GAZETTEER_PATH", "")
+    FREIGHT_CELL_DEG: float = float(os.getenv("FREIGHT_CELL_DEG", "0.1"))
+    FREIGHT_ROAD_FACTOR: float = float(os.getenv("FREIGHT_ROAD_FACTOR", "1.3"))
+    FREIGHT_MATCH_MAX_DEADHEAD_KM: float = float(os.getenv("FREIGHT_MATCH_MAX_DEADHEAD_KM", "250"))
+    FREIGHT_MATCH_FIT_FLOOR: float = float(os.getenv("FREIGHT_MATCH_FIT_FLOOR", "0.5"))
+    FREIGHT_MATCH_REFRESH_SECS: float = float(os.getenv("FREIGHT_MATCH_REFRESH_SECS", "10"))
+    FREIGHT_MATCH_REBUILD_SECS: float = float(os.getenv("FREIGHT_MATCH_REBUILD_SECS", "300"))
+    # Push: a new load is offered to the best carriers last seen within the radius
+    FREIGHT_PUSH_RADIUS_KM: float = float(os.getenv("FREIGHT_PUSH_RADIUS_KM", "150"))
+    FREIGHT_PUSH_MAX_CARRIERS: int = int(os.getenv("FREIGHT_PUSH_MAX_CARRIERS", "20"))
+    FREIGHT_PUSH_LOCATION_MAX_AGE_MINS: int = int(os.getenv("FREIGHT_PUSH_LOCATION_MAX_AGE_MINS", "240"))
+    # Reverse auctions: open loads past bid_deadline are awarded to the lowest bid by the sweeper
+    FREIGHT_AUCTION_SWEEP_SECS: int = int(os.getenv("FREIGHT_AUCTION_SWEEP_SECS", "15"))
+    FREIGHT_AUCTION_MAX_DAYS: int = int(os.getenv("FREIGHT_AUCTION_MAX_DAYS", "14"))
+    SCHEDULER_PARTITIONS: int = int(os.getenv("SCHEDULER_PARTITIONS", "1"))
 
     @property
     def jwt_expires_delta(self) -> timedelta:
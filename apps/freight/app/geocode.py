@@ -0,0 +1,132 @@
+"""Place names → coordinates for load origins and destinations.
+
+Loads are posted with free-text places ("Aleppo", "Damascus, Syria",
+"Homs industrial zone", "حلب"). Without an external geocoder the service
+resolves them against a gazetteer of the cities freight runs between: the
+built-in table below, extended or overridden by a JSON file at
+``FREIGHT_GAZETTEER_PATH`` (``{"Name": {"lat": .., "lon": .., "aliases": [..]}}``).
+
+Lookup normalizes case, accents, punctuation and Arabic/Latin article
+prefixes, then tries the whole text, each comma-separated part, and finally
+the longest known name that appears as whole words inside the text. A literal
+``"lat,lon"`` is taken as coordinates. Unknown places return ``None``; such
+loads stay listed in ``/carrier/loads/available`` but are not matched.
+"""
+from __future__ import annotations
+
+import json
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Mapping, Optional, Sequence, Tuple
+
+from .config import settings
+
+
+@dataclass(frozen=True)
+class Place:
+    name: str
+    lat: float
+    lon: float
+
+
+# name: (lat, lon, aliases)
+PLACES: Dict[str, Tuple[float, float, Sequence[str]]] = {
+    "Damascus": (33.5138, 36.2765, ("dimashq", "sham", "ash sham", "دمشق", "الشام")),
+    "Aleppo": (36.2021, 37.1343, ("halab", "حلب")),
+    "Homs": (34.7324, 36.7137, ("hims", "حمص")),
+    "Hama": (35.1318, 36.7578, ("hamah", "حماة", "حماه")),
+    "Latakia": (35.5317, 35.7918, ("lattakia", "ladhiqiyah", "lazkiye", "اللاذقية")),
+    "Tartus": (34.8890, 35.8866, ("tartous", "tartous port", "طرطوس")),
+    "Deir ez-Zor": (35.3359, 40.1408, ("deir ezzor", "deir el zor", "deir al zor", "dayr az zawr", "دير الزور")),
+    "Raqqa": (35.9528, 39.0079, ("raqqah", "rakka", "الرقة")),
+    "Idlib": (35.9306, 36.6339, ("idleb", "إدلب", "ادلب")),
+    "Daraa": (32.6189, 36.1021, ("deraa", "dara a", "درعا")),
+    "As-Suwayda": (32.7090, 36.5695, ("suwayda", "sweida", "swaida", "السويداء")),
+    "Quneitra": (33.1250, 35.8240, ("qunaitra", "القنيطرة")),
+    "Al-Hasakah": (36.5024, 40.7477, ("hasakah", "hasaka", "hassakeh", "الحسكة")),
+    "Qamishli": (37.0522, 41.2318, ("kamishli", "qamishlo", "القامشلي")),
+    "Palmyra": (34.5560, 38.2840, ("tadmur", "tadmor", "تدمر")),
+    "Abu Kamal": (34.4537, 40.9187, ("albu kamal", "bukamal", "البوكمال")),
+    "Manbij": (36.5281, 37.9549, ("منبج",)),
+    "Jableh": (35.3610, 35.9256, ("jablah", "جبلة")),
+    "Baniyas": (35.1822, 35.9491, ("banias", "بانياس")),
+    "Nabk": (34.0236, 36.7285, ("an nabk", "النبك")),
+    "Beirut": (33.8938, 35.5018, ("bayrut", "بيروت")),
+    "Tripoli": (34.4367, 35.8497, ("trablous", "طرابلس")),
+    "Amman": (31.9454, 35.9284, ("عمان",)),
+    "Irbid": (32.5556, 35.8500, ("اربد", "إربد")),
+    "Aqaba": (29.5321, 35.0063, ("العقبة",)),
+    "Baghdad": (33.3152, 44.3661, ("بغداد",)),
+    "Mosul": (36.3450, 43.1450, ("الموصل",)),
+    "Erbil": (36.1911, 44.0092, ("arbil", "hawler", "أربيل", "اربيل")),
+    "Gaziantep": (37.0662, 37.3833, ("antep", "عنتاب")),
+    "Mersin": (36.8121, 34.6415, ("مرسين",)),
+    "Istanbul": (41.0082, 28.9784, ("اسطنبول",)),
+    "Riyadh": (24.7136, 46.6753, ("الرياض",)),
+    "Jeddah": (21.4858, 39.1925, ("jiddah", "جدة")),
+    "Dubai": (25.2048, 55.2708, ("دبي",)),
+}
+
+_ARTICLES = ("al ", "el ", "as ", "ad ", "ar ", "az ", "an ", "ash ", "at ")
+_COORDS = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*[,; ]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+
+def normalize(text: str) -> str:
+    s = unicodedata.normalize("NFKD", text or "").casefold()
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    s = re.sub(r"[\W_]+", " ", s).strip()
+    # Arabic article is written attached ("الرقة"); Latin transliterations are separate words ("al raqqa")
+    if s.startswith("ال") and len(s) > 3:
+        s = s[2:]
+    for a in _ARTICLES:
+        if s.startswith(a) and len(s) > len(a) + 2:
+            s = s[len(a):]
+            break
+    return s
+
+
+class Gazetteer:
+    def __init__(self, places: Mapping[str, Tuple[float, float, Sequence[str]]]):
+        self._names: Dict[str, Place] = {}
+        for name, (lat, lon, aliases) in places.items():
+            p = Place(name, float(lat), float(lon))
+            for n in (name, *aliases):
+                key = normalize(n)
+                if key:
+                    self._names[key] = p
+        # Longest first so "deir ez zor" wins over a shorter name inside it
+        self._by_length = sorted(self._names, key=len, reverse=True)
+
+    def lookup(self, text: str) -> Optional[Place]:
+        m = _COORDS.match(text or "")
+        if m:
+            lat, lon = float(m.group(1)), float(m.group(2))
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return Place(f"{lat},{lon}", lat, lon)
+        for part in [text, *(text or "").split(",")]:
+            hit = self._names.get(normalize(part))
+            if hit is not None:
+                return hit
+        padded = f" {normalize(text)} "
+        for key in self._by_length:
+            if f" {key} " in padded:
+                return self._names[key]
+        return None
+
+
+@lru_cache(maxsize=1)
+def gazetteer() -> Gazetteer:
+    places = dict(PLACES)
+    path = settings.FREIGHT_GAZETTEER_PATH
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for name, p in json.load(f).items():
+                places[name] = (float(p["lat"]), float(p["lon"]), tuple(p.get("aliases") or ()))
+    return Gazetteer(places)
+
+
+@lru_cache(maxsize=4096)
+def geocode(text: str) -> Optional[Place]:
+    return gazetteer().lookup(text)
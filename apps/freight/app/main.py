@@ -23,6 +23,27 @@ from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_
 from .middleware_request_id import RequestIDMiddleware
 from .middleware_rate_limit import SlidingWindowLimiter
 from .middleware_rate_limit_redis import RedisRateLimiter
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, sql_partition_clause, store_from_env
+
+
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler closing reverse auctions past their bid deadline (lowest bid wins, or the auction ends unsold)."""
+    from .auctions import close_due
+    from .database import SessionLocal
+    from .models import Load
+
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="freight", **kw)
+
+    def _close(ctx):
+        with SessionLocal() as db:
+            return close_due(db, where=sql_partition_clause(Load.id, ctx))
+
+    secs = settings.FREIGHT_AUCTION_SWEEP_SECS
+    sched.add_job(
+        "freight_auction_close", _close, IntervalTrigger(max(secs, 1)),
+        partitions=settings.SCHEDULER_PARTITIONS, lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    return sched
 
 
 def create_app() -> FastAPI:
@@ -70,6 +91,42 @@ def create_app() -> FastAPI:
 
     if settings.AUTO_CREATE_SCHEMA:
         Base.metadata.create_all(bind=engine)
+        # Columns added for load matching on tables created before it
+        with engine.begin() as conn:
+            for ddl in (
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS origin_lat DOUBLE PRECISION",
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS origin_lon DOUBLE PRECISION",
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS dest_lat DOUBLE PRECISION",
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS dest_lon DOUBLE PRECISION",
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS trip_km DOUBLE PRECISION",
+                "ALTER TABLE carrier_profiles ADD COLUMN IF NOT EXISTS capacity_kg INTEGER",
+                "ALTER TABLE carrier_locations ADD COLUMN IF NOT EXISTS cell BIGINT",
+                "CREATE INDEX IF NOT EXISTS ix_carrier_loc_cell ON carrier_locations (cell)",
+                "CREATE INDEX IF NOT EXISTS ix_loads_status_created ON loads (status, created_at)",
+                # Awards and auctions
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS awarded_bid_id UUID",
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS awarded_at TIMESTAMP",
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS auction_status VARCHAR(16)",
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS bid_deadline TIMESTAMP",
+                "ALTER TABLE loads ADD COLUMN IF NOT EXISTS reserve_cents INTEGER",
+                "ALTER TABLE bids ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+                "CREATE INDEX IF NOT EXISTS ix_loads_auction_deadline ON loads (bid_deadline) WHERE auction_status = 'open'",
+            ):
+                conn.exec_driver_sql(ddl)
+        try:
+            # Fails while an old double award is still in the table; awards are single-winner either way
+            with engine.begin() as conn:
+                conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS uq_bid_load_accepted ON bids (load_id) WHERE status = 'accepted'")
+        except Exception:
+            pass
+        try:
+            from .database import SessionLocal
+            from .matching import backfill_locations
+
+            with SessionLocal() as db:
+                backfill_locations(db)
+        except Exception:
+            pass
 
     @app.get("/health")
     def health():
@@ -109,6 +166,9 @@ def create_app() -> FastAPI:
     app.include_router(loads_router.router)
     app.include_router(bids_router.router)
     app.include_router(chats_router.router)
+
+    if settings.FREIGHT_AUCTION_SWEEP_SECS > 0:
+        install_scheduler(app, build_scheduler())
     return app
 
 
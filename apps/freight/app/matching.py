@@ -0,0 +1,416 @@
+"""Load matching: rank open loads for a carrier, push new loads to nearby carriers.
+
+Loads are geocoded when posted (explicit coordinates or ``app.geocode``) and
+carry their origin/destination coordinates and ``trip_km``, the straight-line
+trip times ``FREIGHT_ROAD_FACTOR``. For a carrier at a point with capacity
+``C``, an open load is a candidate when it fits (``weight_kg <= C``; any
+weight when ``C`` is unknown) and the empty drive to its origin (deadhead,
+same road factor) is within ``max_deadhead_km``. Candidates are ranked by::
+
+    score = rate * (FIT_FLOOR + (1 - FIT_FLOOR) * fit)
+    rate  = price_cents / (deadhead_km + trip_km)   # revenue per km actually driven
+    fit   = weight_kg / C                          # 1.0 when C is unknown
+
+so a long empty drive costs a load the same way a low price does, and a
+fuller truck ranks higher (by up to 1 / FIT_FLOOR).
+
+``LoadIndex`` keeps open loads in memory, bucketed by origin grid cell and
+trip-length band, with each bucket's highest price, shortest trip and
+lightest load; blocks of 4 x 4 cells carry the same bounds per band. Ranking
+opens blocks and scans buckets best-first by an upper bound on any score
+inside (highest price over nearest possible deadhead plus shortest trip),
+walks each bucket by descending price, and stops when the bound drops below
+the current k-th best, so a carrier scores the loads near the top rather
+than the whole board. The index is refreshed from the DB with the
+loads posted since the last refresh every ``FREIGHT_MATCH_REFRESH_SECS`` and
+rebuilt every ``FREIGHT_MATCH_REBUILD_SECS``; ``best_loads`` re-reads its
+picks and drops any taken in the meantime (on another replica, say).
+
+Push: ``push_new_load`` scores a newly posted load for carriers whose last
+location (``carrier_locations.cell``) is within ``FREIGHT_PUSH_RADIUS_KM`` of
+its origin and was reported in the last ``FREIGHT_PUSH_LOCATION_MAX_AGE_MINS``;
+the best ``FREIGHT_PUSH_MAX_CARRIERS`` get a ``load_match_notices`` row and a
+``load.matched`` notification.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from superapp_shared.geo import cell_bounds, cell_id, cells_around, haversine_m
+
+from .config import settings
+from .geocode import geocode
+from .models import CarrierLocation, CarrierProfile, Load, LoadMatchNotice
+from .utils.notify import notify
+
+
+# Loads posted this close to the refresh watermark are re-read, so commit lag does not skip them
+_WATERMARK_OVERLAP = timedelta(seconds=5)
+
+
+@dataclass
+class Match:
+    load_id: str
+    deadhead_km: float
+    trip_km: float
+    rate_cents_per_km: float
+    capacity_fit: Optional[float]
+    score: float
+
+
+def road_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    return haversine_m(lat1, lon1, lat2, lon2) / 1000.0 * settings.FREIGHT_ROAD_FACTOR
+
+
+def locate(load: Load, origin_lat=None, origin_lon=None, dest_lat=None, dest_lon=None) -> None:
+    """Set the load's coordinates (given, else geocoded from its place names) and ``trip_km``."""
+    if origin_lat is None or origin_lon is None:
+        p = geocode(load.origin)
+        origin_lat, origin_lon = (p.lat, p.lon) if p else (None, None)
+    if dest_lat is None or dest_lon is None:
+        p = geocode(load.destination)
+        dest_lat, dest_lon = (p.lat, p.lon) if p else (None, None)
+    load.origin_lat, load.origin_lon, load.dest_lat, load.dest_lon = origin_lat, origin_lon, dest_lat, dest_lon
+    load.trip_km = road_km(origin_lat, origin_lon, dest_lat, dest_lon) if None not in (origin_lat, dest_lat) else None
+
+
+def score(deadhead_km: float, trip_km: float, price_cents: int, weight_kg: int, capacity_kg: Optional[int]) -> Tuple[float, float, Optional[float]]:
+    """(score, rate, fit) for one load and carrier; see the module docstring."""
+    rate = price_cents / max(1.0, deadhead_km + trip_km)
+    fit = min(1.0, weight_kg / capacity_kg) if capacity_kg else None
+    floor = settings.FREIGHT_MATCH_FIT_FLOOR
+    return rate * (floor + (1.0 - floor) * (1.0 if fit is None else fit)), rate, fit
+
+
+# --- index ----------------------------------------------------------------------
+
+
+@dataclass
+class _Entry:
+    load_id: str
+    lat: float
+    lon: float
+    weight_kg: int
+    price_cents: int
+    trip_km: float
+
+
+@dataclass
+class _Bounds:
+    # Only tighten on add; removals leave them loose, which keeps them valid
+    max_price: int = 0
+    min_trip: float = float("inf")
+    min_weight: int = 2**31
+
+    def update(self, e: _Entry) -> None:
+        self.max_price = max(self.max_price, e.price_cents)
+        self.min_trip = min(self.min_trip, e.trip_km)
+        self.min_weight = min(self.min_weight, e.weight_kg)
+
+
+@dataclass
+class _Band(_Bounds):
+    """Loads from one origin cell with trips of similar length (see ``_band``)."""
+
+    entries: Dict[str, _Entry] = field(default_factory=dict)
+    _by_price: Optional[List[_Entry]] = None
+
+    def add(self, e: _Entry) -> None:
+        self.entries[e.load_id] = e
+        self.update(e)
+        self._by_price = None
+
+    def pop(self, load_id: str) -> None:
+        if self.entries.pop(load_id, None) is not None:
+            self._by_price = None
+
+    def by_price(self) -> List[_Entry]:
+        if self._by_price is None:
+            self._by_price = sorted(self.entries.values(), key=lambda e: -e.price_cents)
+        return self._by_price
+
+
+@dataclass
+class _Block:
+    """A square of ``_BLOCK`` x ``_BLOCK`` cells: its occupied cells and per-band bounds over them."""
+
+    cells: set = field(default_factory=set)
+    bands: Dict[int, _Bounds] = field(default_factory=dict)
+
+
+# Cells per block side; blocks let a search skip whole regions before looking at their cells
+_BLOCK = 4
+
+
+def _band(trip_km: float) -> int:
+    # <25 km, 25-50, 50-100, 100-200, ...: short, well-paid trips get their own tight bound
+    return 0 if trip_km < 25 else int(math.log2(trip_km / 25)) + 1
+
+
+def _min_km_to_cell(lat: float, lon: float, cell: int, cell_deg: float) -> float:
+    lo_lat, lo_lon, hi_lat, hi_lon = cell_bounds(cell, cell_deg)
+    near_lat, near_lon = min(max(lat, lo_lat), hi_lat), min(max(lon, lo_lon), hi_lon)
+    # The clamped point is the nearest one up to a sliver of curvature; shave 1% so the bound stays a bound
+    return road_km(lat, lon, near_lat, near_lon) * 0.99
+
+
+def _bound(b: _Bounds, dmin: float) -> float:
+    # Best possible rate for anything in b; the fit factor is at most 1, so this bounds the score too
+    return b.max_price / max(1.0, dmin + b.min_trip)
+
+
+class LoadIndex:
+    def __init__(self, cell_deg: Optional[float] = None):
+        self.cell_deg = cell_deg or settings.FREIGHT_CELL_DEG
+        self.block_deg = self.cell_deg * _BLOCK
+        self._buckets: Dict[int, Dict[int, _Band]] = {}  # cell -> trip band -> loads
+        self._blocks: Dict[int, _Block] = {}
+        self._cell_of: Dict[str, Tuple[int, int, int]] = {}  # load -> (cell, band, block)
+        self._lock = threading.Lock()
+        self._watermark: Optional[datetime] = None
+        self._refreshed = 0.0
+        self._rebuilt = 0.0
+        self.scored = 0  # loads scored by rank(), for benchmarks
+
+    def __len__(self) -> int:
+        return len(self._cell_of)
+
+    def _pop(self, load_id: str) -> None:
+        key = self._cell_of.pop(load_id, None)
+        if key is None:
+            return
+        cell, band, block = key
+        bands = self._buckets[cell]
+        bands[band].pop(load_id)
+        if not bands[band].entries:
+            del bands[band]
+            if not bands:
+                del self._buckets[cell]
+                self._blocks[block].cells.discard(cell)
+                if not self._blocks[block].cells:
+                    del self._blocks[block]
+
+    def add(self, load_id, lat: float, lon: float, weight_kg: int, price_cents: int, trip_km: float) -> None:
+        e = _Entry(str(load_id), float(lat), float(lon), int(weight_kg or 0), int(price_cents or 0), float(trip_km))
+        cell, band, block = cell_id(e.lat, e.lon, self.cell_deg), _band(e.trip_km), cell_id(e.lat, e.lon, self.block_deg)
+        with self._lock:
+            self._pop(e.load_id)
+            self._buckets.setdefault(cell, {}).setdefault(band, _Band()).add(e)
+            blk = self._blocks.setdefault(block, _Block())
+            blk.cells.add(cell)
+            blk.bands.setdefault(band, _Bounds()).update(e)
+            self._cell_of[e.load_id] = (cell, band, block)
+
+    def add_load(self, load: Load) -> None:
+        if load.status == "posted" and load.origin_lat is not None and load.trip_km is not None:
+            self.add(load.id, load.origin_lat, load.origin_lon, load.weight_kg, load.price_cents, load.trip_km)
+
+    def discard(self, load_ids: Iterable) -> None:
+        with self._lock:
+            for lid in load_ids:
+                self._pop(str(lid))
+
+    def refresh(self, db: Session, full: bool = False) -> int:
+        """Load open, geocoded loads from the DB: all of them (``full``) or those posted since the last refresh."""
+        q = select(Load.id, Load.origin_lat, Load.origin_lon, Load.weight_kg, Load.price_cents, Load.trip_km, Load.created_at).where(
+            Load.status == "posted", Load.origin_lat.is_not(None), Load.trip_km.is_not(None),
+        )
+        if not full and self._watermark is not None:
+            q = q.where(Load.created_at >= self._watermark - _WATERMARK_OVERLAP)
+        started = time.monotonic()
+        rows = db.execute(q).all()
+        if full:
+            # Build aside and swap, so readers never see a half-filled index
+            fresh = LoadIndex(self.cell_deg)
+            for lid, lat, lon, w, p, trip, _ in rows:
+                fresh.add(lid, lat, lon, w, p, trip)
+            with self._lock:
+                self._buckets, self._blocks, self._cell_of = fresh._buckets, fresh._blocks, fresh._cell_of
+            self._rebuilt = started
+        else:
+            for lid, lat, lon, w, p, trip, _ in rows:
+                self.add(lid, lat, lon, w, p, trip)
+        if rows:
+            newest = max(r[6] for r in rows)
+            self._watermark = newest if self._watermark is None else max(self._watermark, newest)
+        self._refreshed = started
+        return len(rows)
+
+    def ensure_fresh(self, db: Session) -> None:
+        now = time.monotonic()
+        if not self._rebuilt or now - self._rebuilt >= settings.FREIGHT_MATCH_REBUILD_SECS:
+            self.refresh(db, full=True)
+        elif now - self._refreshed >= settings.FREIGHT_MATCH_REFRESH_SECS:
+            self.refresh(db)
+
+    def rank(self, lat: float, lon: float, capacity_kg: Optional[int] = None, limit: int = 20, max_deadhead_km: Optional[float] = None) -> List[Match]:
+        """Top ``limit`` open loads for a carrier at (lat, lon), best first."""
+        max_dh = settings.FREIGHT_MATCH_MAX_DEADHEAD_KM if max_deadhead_km is None else max_deadhead_km
+        radius_m = max_dh / settings.FREIGHT_ROAD_FACTOR * 1000.0
+        top: List[Tuple[float, str, Match]] = []  # min-heap of the best so far
+        # Max-heap (negated bound) of blocks to open and bands to scan; a cell on a block
+        # edge can be reached from two blocks, so bands are pushed once
+        frontier: list = []
+        pushed = set()
+        scored = 0
+
+        def fits(b: _Bounds) -> bool:
+            return not (capacity_kg and b.min_weight > capacity_kg)
+
+        with self._lock:
+            for block in cells_around(lat, lon, radius_m, self.block_deg):
+                blk = self._blocks.get(block)
+                if blk is None:
+                    continue
+                dmin = _min_km_to_cell(lat, lon, block, self.block_deg)
+                bounds = [_bound(b, dmin) for b in blk.bands.values() if fits(b)]
+                if dmin <= max_dh and bounds:
+                    frontier.append((-max(bounds), id(blk), dmin, blk))
+            heapq.heapify(frontier)
+            while frontier:
+                neg, _, dmin, item = heapq.heappop(frontier)
+                threshold = top[0][0] if len(top) >= limit else -1.0
+                if -neg < threshold:
+                    break
+                if isinstance(item, _Block):
+                    for cell in item.cells:
+                        dmin = _min_km_to_cell(lat, lon, cell, self.cell_deg)
+                        if dmin > max_dh:
+                            continue
+                        for band in self._buckets[cell].values():
+                            if fits(band) and id(band) not in pushed and _bound(band, dmin) >= threshold:
+                                pushed.add(id(band))
+                                heapq.heappush(frontier, (-_bound(band, dmin), id(band), dmin, band))
+                    continue
+                for e in item.by_price():
+                    threshold = top[0][0] if len(top) >= limit else -1.0
+                    if e.price_cents / max(1.0, dmin + item.min_trip) < threshold:
+                        break  # cheaper loads in this band cannot beat the k-th best either
+                    if (capacity_kg and e.weight_kg > capacity_kg) or e.price_cents / max(1.0, dmin + e.trip_km) < threshold:
+                        continue
+                    dh = road_km(lat, lon, e.lat, e.lon)
+                    if dh > max_dh:
+                        continue
+                    scored += 1
+                    s, rate, fit = score(dh, e.trip_km, e.price_cents, e.weight_kg, capacity_kg)
+                    m = (s, e.load_id, Match(e.load_id, round(dh, 1), round(e.trip_km, 1), round(rate, 2), None if fit is None else round(fit, 3), round(s, 2)))
+                    if len(top) < limit:
+                        heapq.heappush(top, m)
+                    elif m[:2] > top[0][:2]:
+                        heapq.heapreplace(top, m)
+        self.scored += scored
+        return [m for _, _, m in sorted(top, key=lambda t: (-t[0], t[2].deadhead_km, t[1]))]
+
+
+index = LoadIndex()
+
+
+def best_loads(db: Session, lat: float, lon: float, capacity_kg: Optional[int], limit: int = 20, max_deadhead_km: Optional[float] = None, idx: Optional[LoadIndex] = None) -> List[Tuple[Load, Match]]:
+    """Ranked open loads with their rows; picks taken since the last refresh are dropped and replaced."""
+    idx = idx or index
+    idx.ensure_fresh(db)
+    for _ in range(3):
+        ranked = idx.rank(lat, lon, capacity_kg, limit, max_deadhead_km)
+        rows = {str(l.id): l for l in db.execute(select(Load).where(Load.id.in_([m.load_id for m in ranked]), Load.status == "posted")).scalars()}
+        stale = [m.load_id for m in ranked if m.load_id not in rows]
+        if not stale:
+            break
+        idx.discard(stale)
+    return [(rows[m.load_id], m) for m in ranked if m.load_id in rows]
+
+
+# --- push -----------------------------------------------------------------------
+
+
+def set_carrier_cell(loc: CarrierLocation) -> None:
+    loc.cell = cell_id(loc.lat, loc.lon, settings.FREIGHT_CELL_DEG)
+
+
+def carriers_for_load(db: Session, load: Load, radius_km: Optional[float] = None, limit: Optional[int] = None, now: Optional[datetime] = None) -> List[Tuple[str, Match]]:
+    """(carrier_id, match) for recently located carriers near the origin that can take the load, best first."""
+    if load.origin_lat is None or load.trip_km is None:
+        return []
+    radius_km = settings.FREIGHT_PUSH_RADIUS_KM if radius_km is None else radius_km
+    limit = settings.FREIGHT_PUSH_MAX_CARRIERS if limit is None else limit
+    since = (now or datetime.utcnow()) - timedelta(minutes=settings.FREIGHT_PUSH_LOCATION_MAX_AGE_MINS)
+    cells = cells_around(load.origin_lat, load.origin_lon, radius_km / settings.FREIGHT_ROAD_FACTOR * 1000.0, settings.FREIGHT_CELL_DEG)
+    rows = db.execute(
+        select(CarrierLocation.carrier_id, CarrierLocation.lat, CarrierLocation.lon, CarrierProfile.capacity_kg)
+        .join(CarrierProfile, CarrierProfile.id == CarrierLocation.carrier_id)
+        .where(
+            CarrierLocation.cell.in_(cells), CarrierLocation.updated_at >= since, CarrierProfile.status == "approved",
+            or_(CarrierProfile.capacity_kg.is_(None), CarrierProfile.capacity_kg >= load.weight_kg),
+        )
+    ).all()
+    out = []
+    for cid, lat, lon, cap in rows:
+        dh = road_km(lat, lon, load.origin_lat, load.origin_lon)
+        if dh > radius_km:
+            continue
+        s, rate, fit = score(dh, load.trip_km, load.price_cents, load.weight_kg, cap)
+        out.append((str(cid), Match(str(load.id), round(dh, 1), round(load.trip_km, 1), round(rate, 2), None if fit is None else round(fit, 3), round(s, 2))))
+    out.sort(key=lambda x: (-x[1].score, x[1].deadhead_km))
+    return out[:limit]
+
+
+def push_new_load(db: Session, load: Load) -> List[str]:
+    """Record and send ``load.matched`` to the best nearby carriers; returns the carriers notified (once per load)."""
+    picks = carriers_for_load(db, load)
+    if not picks:
+        return []
+    inserted = db.execute(
+        pg_insert(LoadMatchNotice.__table__)
+        .values([{"carrier_id": cid, "load_id": load.id, "deadhead_km": m.deadhead_km, "score": m.score, "created_at": datetime.utcnow()} for cid, m in picks])
+        .on_conflict_do_nothing(index_elements=["carrier_id", "load_id"])
+        .returning(LoadMatchNotice.__table__.c.carrier_id)
+    ).scalars().all()
+    db.commit()
+    fresh = {str(c) for c in inserted}
+    for cid, m in picks:
+        if cid in fresh:
+            notify("load.matched", {
+                "carrier_id": cid, "load_id": str(load.id), "origin": load.origin, "destination": load.destination,
+                "weight_kg": load.weight_kg, "price_cents": load.price_cents, "deadhead_km": m.deadhead_km, "score": m.score,
+            })
+    return [cid for cid, _ in picks if cid in fresh]
+
+
+def push_new_load_by_id(load_id) -> List[str]:
+    """Background-task entry point (own session, after the posting request committed)."""
+    from .database import SessionLocal
+
+    with SessionLocal() as db:
+        load = db.get(Load, load_id)
+        if load is None or load.status != "posted":
+            return []
+        return push_new_load(db, load)
+
+
+def backfill_locations(db: Session, batch: int = 1000) -> int:
+    """Geocode open loads posted before matching existed and set carrier location cells; returns loads located."""
+    n, after = 0, None
+    while True:
+        q = select(Load).where(Load.status == "posted", Load.origin_lat.is_(None)).order_by(Load.id).limit(batch)
+        if after is not None:
+            q = q.where(Load.id > after)
+        rows = db.execute(q).scalars().all()
+        for l in rows:
+            locate(l)
+            n += l.origin_lat is not None
+        db.commit()
+        if len(rows) < batch:
+            break
+        after = rows[-1].id
+    for loc in db.execute(select(CarrierLocation).where(CarrierLocation.cell.is_(None))).scalars():
+        set_carrier_cell(loc)
+    db.commit()
+    return n
@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 from sqlalchemy import (
-    Column, String, Integer, DateTime, Boolean, ForeignKey, Index, UniqueConstraint, Float
+    BigInteger, Column, String, Integer, DateTime, Boolean, ForeignKey, Index, UniqueConstraint, Float, text
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base, relationship
@@ -33,6 +33,7 @@ class CarrierProfile(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, unique=True)
     company_name = Column(String(128), nullable=True)
     status = Column(String(16), nullable=False, default="approved")  # approved in dev
+    capacity_kg = Column(Integer, nullable=True)  # payload limit used for matching; None = unknown
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     user = relationship("User", back_populates="carrier")
@@ -44,17 +45,23 @@ class CarrierLocation(Base):
     __table_args__ = (
         UniqueConstraint("carrier_id", name="uq_carrier_location"),
         Index("ix_carrier_loc_updated", "updated_at"),
+        Index("ix_carrier_loc_cell", "cell"),
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     carrier_id = Column(UUID(as_uuid=True), ForeignKey("carrier_profiles.id"), nullable=False, unique=True)
     lat = Column(Float, nullable=False)
     lon = Column(Float, nullable=False)
+    cell = Column(BigInteger, nullable=True)  # superapp_shared.geo cell at FREIGHT_CELL_DEG
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 
 class Load(Base):
     __tablename__ = "loads"
+    __table_args__ = (
+        Index("ix_loads_status_created", "status", "created_at"),
+        Index("ix_loads_auction_deadline", "bid_deadline", postgresql_where=text("auction_status = 'open'")),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     shipper_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -69,10 +76,39 @@ class Load(Base):
     pickup_at = Column(DateTime, nullable=True)
     delivered_at = Column(DateTime, nullable=True)
     pod_url = Column(String(512), nullable=True)
+    # Geocoded at posting (see app/geocode.py); trip_km is the estimated road distance
+    origin_lat = Column(Float, nullable=True)
+    origin_lon = Column(Float, nullable=True)
+    dest_lat = Column(Float, nullable=True)
+    dest_lon = Column(Float, nullable=True)
+    trip_km = Column(Float, nullable=True)
+    # Award (see app/auctions.py): the bid that won the load, and an optional reverse auction
+    awarded_bid_id = Column(UUID(as_uuid=True), nullable=True)
+    awarded_at = Column(DateTime, nullable=True)
+    auction_status = Column(String(16), nullable=True)  # open|awarded|unsold; None = no auction
+    bid_deadline = Column(DateTime, nullable=True)
+    reserve_cents = Column(Integer, nullable=True)  # highest bid the shipper will take
 
     carrier = relationship("CarrierProfile", back_populates="loads")
 
 
+class LoadMatchNotice(Base):
+    """A new load pushed to a nearby carrier (one per carrier and load)."""
+
+    __tablename__ = "load_match_notices"
+    __table_args__ = (
+        UniqueConstraint("carrier_id", "load_id", name="uq_load_match_notice"),
+        Index("ix_load_match_carrier_created", "carrier_id", "created_at"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    carrier_id = Column(UUID(as_uuid=True), ForeignKey("carrier_profiles.id"), nullable=False)
+    load_id = Column(UUID(as_uuid=True), ForeignKey("loads.id"), nullable=False)
+    deadhead_km = Column(Float, nullable=False)
+    score = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
 class LoadChatMessage(Base):
     __tablename__ = "load_chat_messages"
     __table_args__ = (
@@ -92,6 +128,8 @@ class Bid(Base):
     __table_args__ = (
         Index("ix_bid_load", "load_id"),
         Index("ix_bid_created", "created_at"),
+        # Backstop for the award transition: a load never has two accepted bids
+        Index("uq_bid_load_accepted", "load_id", unique=True, postgresql_where=text("status = 'accepted'")),
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
@@ -100,3 +138,23 @@ class Bid(Base):
     amount_cents = Column(Integer, nullable=False)
     status = Column(String(16), nullable=False, default="pending")  # pending|accepted|rejected|canceled
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=True)
+
+
+class BidEvent(Base):
+    """Bid history: one row per placement, revision and status change."""
+
+    __tablename__ = "bid_events"
+    __table_args__ = (
+        Index("ix_bid_event_load_created", "load_id", "created_at"),
+        Index("ix_bid_event_bid", "bid_id"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    bid_id = Column(UUID(as_uuid=True), ForeignKey("bids.id"), nullable=False)
+    load_id = Column(UUID(as_uuid=True), ForeignKey("loads.id"), nullable=False)
+    carrier_id = Column(UUID(as_uuid=True), ForeignKey("carrier_profiles.id"), nullable=False)
+    event = Column(String(16), nullable=False)  # placed|revised|accepted|rejected|canceled
+    amount_cents = Column(Integer, nullable=False)
+    actor = Column(String(16), nullable=False)  # carrier|shipper|auction
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
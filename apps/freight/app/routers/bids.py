@@ -2,9 +2,10 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 from ..auth import get_current_user, get_db
-from ..models import User, CarrierProfile, Load, Bid
-from sqlalchemy import select
-from ..schemas import BidCreateIn, BidOut, BidsListOut
+from ..models import User, CarrierProfile, Load, Bid, BidEvent
+from sqlalchemy import func, select
+from ..schemas import AuctionOut, BidCreateIn, BidEventOut, BidEventsOut, BidOut, BidsListOut
+from .. import auctions, matching
 
 
 router = APIRouter(prefix="/bids", tags=["bids"]) 
@@ -23,13 +24,12 @@ def _to_out(b: Bid) -> BidOut:
 
 @router.post("/load/{load_id}", response_model=BidOut)
 def create_bid(load_id: str, payload: BidCreateIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # one live bid per carrier and load: bidding again revises it
     carrier = _get_carrier(db, user)
-    l = db.get(Load, load_id)
-    if l is None or l.status != "posted":
-        raise HTTPException(status_code=404, detail="Load not available")
-    b = Bid(load_id=l.id, carrier_id=carrier.id, amount_cents=payload.amount_cents, status="pending")
-    db.add(b)
-    db.flush()
+    try:
+        b = auctions.place_bid(db, load_id, carrier.id, payload.amount_cents)
+    except auctions.AuctionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     return _to_out(b)
 
 
@@ -51,37 +51,74 @@ def bids_for_load(load_id: str, user: User = Depends(get_current_user), db: Sess
     return BidsListOut(bids=[_to_out(b) for b in rows])
 
 
+@router.get("/load/{load_id}/history", response_model=BidEventsOut)
+def bid_history(load_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # shipper sees every bid's history; a carrier sees its own
+    l = db.get(Load, load_id)
+    if l is None:
+        raise HTTPException(status_code=404, detail="Load not found")
+    q = db.query(BidEvent).filter(BidEvent.load_id == l.id)
+    if l.shipper_user_id != user.id:
+        q = q.filter(BidEvent.carrier_id == _get_carrier(db, user).id)
+    rows = q.order_by(BidEvent.created_at, BidEvent.id).limit(500).all()
+    return BidEventsOut(events=[
+        BidEventOut(bid_id=str(e.bid_id), carrier_id=str(e.carrier_id), event=e.event, amount_cents=e.amount_cents, actor=e.actor, created_at=e.created_at)
+        for e in rows
+    ])
+
+
+@router.get("/load/{load_id}/auction", response_model=AuctionOut)
+def auction_state(load_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    l = db.get(Load, load_id)
+    if l is None:
+        raise HTTPException(status_code=404, detail="Load not found")
+    if auctions.close_if_due(db, l):
+        db.refresh(l)
+    bids, best = db.execute(select(func.count(), func.min(Bid.amount_cents)).where(Bid.load_id == l.id, Bid.status == "pending")).one()
+    return AuctionOut(
+        load_id=str(l.id), load_status=l.status, auction_status=l.auction_status, bid_deadline=l.bid_deadline,
+        reserve_cents=l.reserve_cents if l.shipper_user_id == user.id else None,
+        bids=bids, best_amount_cents=best, awarded_bid_id=str(l.awarded_bid_id) if l.awarded_bid_id else None,
+    )
+
+
 @router.post("/{bid_id}/accept", response_model=BidOut)
 def accept_bid(bid_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    b = db.execute(select(Bid).where(Bid.id == bid_id).with_for_update()).scalars().first()
+    b = db.get(Bid, bid_id)
     if b is None:
         raise HTTPException(status_code=404, detail="Bid not found")
     l = db.get(Load, b.load_id)
     if l is None or l.shipper_user_id != user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
-    if l.status != "posted":
-        raise HTTPException(status_code=400, detail="Load not available")
-    b.status = "accepted"
-    # assign
-    l.carrier_id = b.carrier_id
-    l.price_cents = b.amount_cents
-    l.status = "assigned"
-    # reject other bids
-    others = db.query(Bid).filter(Bid.load_id == l.id, Bid.id != b.id, Bid.status == "pending").all()
-    for ob in others:
-        ob.status = "rejected"
-    db.flush()
+    try:
+        l, changed = auctions.award(db, b)
+    except auctions.AuctionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    db.commit()
+    matching.index.discard([l.id])
+    auctions.notify_award(l, changed)
     return _to_out(b)
 
 
 @router.post("/{bid_id}/reject", response_model=BidOut)
 def reject_bid(bid_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    b = db.execute(select(Bid).where(Bid.id == bid_id).with_for_update()).scalars().first()
+    b = db.get(Bid, bid_id)
     if b is None:
         raise HTTPException(status_code=404, detail="Bid not found")
     l = db.get(Load, b.load_id)
     if l is None or l.shipper_user_id != user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
-    b.status = "rejected"
-    db.flush()
+    if not auctions.set_bid_status(db, b, "rejected", "shipper"):
+        raise HTTPException(status_code=409, detail="Bid no longer pending")
+    return _to_out(b)
+
+
+@router.post("/{bid_id}/cancel", response_model=BidOut)
+def cancel_bid(bid_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    carrier = _get_carrier(db, user)
+    b = db.get(Bid, bid_id)
+    if b is None or b.carrier_id != carrier.id:
+        raise HTTPException(status_code=404, detail="Bid not found")
+    if not auctions.set_bid_status(db, b, "canceled", "carrier"):
+        raise HTTPException(status_code=409, detail="Bid no longer pending")
     return _to_out(b)
@@ -3,8 +3,10 @@ from sqlalchemy.orm import Session
 
 from fastapi import Query
 from ..auth import get_current_user, get_db
-from ..models import User, CarrierProfile, Load, CarrierLocation
-from ..schemas import CarrierApplyIn, LoadOut, LoadsListOut, CarrierLocationIn
+from ..models import User, CarrierProfile, Load, CarrierLocation, LoadMatchNotice
+from ..schemas import CarrierApplyIn, LoadOut, LoadsListOut, CarrierLocationIn, LoadMatchOut, LoadMatchesOut, LoadNoticeOut, LoadNoticesOut
+from .. import matching
+from .loads import _to_out
 
 
 router = APIRouter(prefix="/carrier", tags=["carrier"])
@@ -14,10 +16,13 @@ router = APIRouter(prefix="/carrier", tags=["carrier"])
 def apply_carrier(payload: CarrierApplyIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     prof = db.query(CarrierProfile).filter(CarrierProfile.user_id == user.id).one_or_none()
     if prof is None:
-        prof = CarrierProfile(user_id=user.id, company_name=payload.company_name or None, status="approved")
+        prof = CarrierProfile(user_id=user.id, company_name=payload.company_name or None, capacity_kg=payload.capacity_kg, status="approved")
         db.add(prof)
         user.role = "carrier"
         db.flush()
+    elif payload.capacity_kg is not None:
+        prof.capacity_kg = payload.capacity_kg
+        db.flush()
     return {"detail": "approved"}
 
 
@@ -57,5 +62,50 @@ def update_location(payload: CarrierLocationIn, user: User = Depends(get_current
         loc.lat = payload.lat
         loc.lon = payload.lon
         loc.updated_at = datetime.utcnow()
+    matching.set_carrier_cell(loc)
     db.flush()
     return {"detail": "ok"}
+
+
+def _get_carrier(db: Session, user: User) -> CarrierProfile:
+    prof = db.query(CarrierProfile).filter(CarrierProfile.user_id == user.id).one_or_none()
+    if prof is None:
+        raise HTTPException(status_code=403, detail="Carrier not found")
+    return prof
+
+
+@router.get("/loads/matches", response_model=LoadMatchesOut)
+def matched_loads(
+    limit: int = Query(20, ge=1, le=100),
+    max_deadhead_km: float | None = Query(None, gt=0, le=2000),
+    lat: float | None = Query(None, ge=-90, le=90),
+    lon: float | None = Query(None, ge=-180, le=180),
+    user: User = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    # best open loads for this carrier: short empty drive, good rate, full truck
+    prof = _get_carrier(db, user)
+    if lat is None or lon is None:
+        loc = db.query(CarrierLocation).filter(CarrierLocation.carrier_id == prof.id).one_or_none()
+        if loc is None:
+            raise HTTPException(status_code=400, detail="Location required")
+        lat, lon = loc.lat, loc.lon
+    ranked = matching.best_loads(db, lat, lon, prof.capacity_kg, limit=limit, max_deadhead_km=max_deadhead_km)
+    return LoadMatchesOut(matches=[
+        LoadMatchOut(load=_to_out(l), deadhead_km=m.deadhead_km, trip_km=m.trip_km, rate_cents_per_km=m.rate_cents_per_km, capacity_fit=m.capacity_fit, score=m.score)
+        for l, m in ranked
+    ])
+
+
+@router.get("/loads/pushed", response_model=LoadNoticesOut)
+def pushed_loads(limit: int = Query(50, ge=1, le=100), user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # loads pushed to this carrier when posted, still open
+    prof = _get_carrier(db, user)
+    rows = (
+        db.query(LoadMatchNotice, Load)
+        .join(Load, Load.id == LoadMatchNotice.load_id)
+        .filter(LoadMatchNotice.carrier_id == prof.id, Load.status == "posted")
+        .order_by(LoadMatchNotice.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return LoadNoticesOut(notices=[LoadNoticeOut(load=_to_out(l), deadhead_km=n.deadhead_km, score=n.score, created_at=n.created_at) for n, l in rows])
@@ -8,6 +8,7 @@ from ..config import settings
 from sqlalchemy import select
 from ..models import User, CarrierProfile, Load
 from ..schemas import LoadOut, LoadsListOut
+from .. import auctions, matching
 
 
 router = APIRouter(prefix="/loads", tags=["loads"])
@@ -15,7 +16,9 @@ router = APIRouter(prefix="/loads", tags=["loads"])
 
 def _to_out(l: Load) -> LoadOut:
     return LoadOut(
-        id=str(l.id), status=l.status, shipper_user_id=str(l.shipper_user_id), carrier_id=str(l.carrier_id) if l.carrier_id else None, origin=l.origin, destination=l.destination, weight_kg=l.weight_kg, price_cents=l.price_cents, payment_request_id=l.payment_request_id, pod_url=l.pod_url
+        id=str(l.id), status=l.status, shipper_user_id=str(l.shipper_user_id), carrier_id=str(l.carrier_id) if l.carrier_id else None, origin=l.origin, destination=l.destination, weight_kg=l.weight_kg, price_cents=l.price_cents, payment_request_id=l.payment_request_id, pod_url=l.pod_url,
+        origin_lat=l.origin_lat, origin_lon=l.origin_lon, dest_lat=l.dest_lat, dest_lon=l.dest_lon, trip_km=round(l.trip_km, 1) if l.trip_km is not None else None,
+        auction_status=l.auction_status, bid_deadline=l.bid_deadline,
     )
 
 
@@ -29,14 +32,16 @@ def _get_carrier(db: Session, user: User) -> CarrierProfile:
 @router.post("/{load_id}/accept", response_model=LoadOut)
 def accept(load_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     carrier = _get_carrier(db, user)
-    l = db.execute(select(Load).where(Load.id == load_id).with_for_update()).scalars().first()
-    if l is None:
+    if db.get(Load, load_id) is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Load not found")
-    if l.status != "posted":
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not available")
-    l.carrier_id = carrier.id
-    l.status = "assigned"
-    db.flush()
+    try:
+        l, rejected = auctions.take(db, load_id, carrier.id)
+    except auctions.AuctionError as e:
+        # a load already taken answers 400 here, as it always has
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.detail)
+    db.commit()
+    matching.index.discard([l.id])
+    auctions.notify_award(l, rejected)
     return _to_out(l)
 
 
@@ -21,6 +21,7 @@ class VerifyOtpIn(BaseModel):
 
 class CarrierApplyIn(BaseModel):
     company_name: Optional[str] = None
+    capacity_kg: Optional[int] = Field(default=None, gt=0)
 
 
 class CarrierLocationIn(BaseModel):
@@ -33,6 +34,14 @@ class LoadCreateIn(BaseModel):
     destination: str
     weight_kg: int = Field(ge=0)
     price_cents: int = Field(ge=0)
+    # Optional exact coordinates; otherwise origin/destination are geocoded by name
+    origin_lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    origin_lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    dest_lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    dest_lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    # Reverse auction: bids are taken until the deadline and the lowest one (at most reserve_cents) wins
+    bid_deadline: Optional[datetime] = None
+    reserve_cents: Optional[int] = Field(default=None, ge=0)
 
 
 class LoadOut(BaseModel):
@@ -46,12 +55,43 @@ class LoadOut(BaseModel):
     price_cents: int
     payment_request_id: Optional[str] = None
     pod_url: Optional[str] = None
+    origin_lat: Optional[float] = None
+    origin_lon: Optional[float] = None
+    dest_lat: Optional[float] = None
+    dest_lon: Optional[float] = None
+    trip_km: Optional[float] = None
+    auction_status: Optional[str] = None
+    bid_deadline: Optional[datetime] = None
 
 
 class LoadsListOut(BaseModel):
     loads: List[LoadOut]
 
 
+class LoadMatchOut(BaseModel):
+    load: LoadOut
+    deadhead_km: float
+    trip_km: float
+    rate_cents_per_km: float
+    capacity_fit: Optional[float] = None
+    score: float
+
+
+class LoadMatchesOut(BaseModel):
+    matches: List[LoadMatchOut]
+
+
+class LoadNoticeOut(BaseModel):
+    load: LoadOut
+    deadhead_km: float
+    score: float
+    created_at: datetime
+
+
+class LoadNoticesOut(BaseModel):
+    notices: List[LoadNoticeOut]
+
+
 class BidCreateIn(BaseModel):
     amount_cents: int = Field(ge=0)
 
@@ -69,6 +109,30 @@ class BidsListOut(BaseModel):
     bids: List[BidOut]
 
 
+class BidEventOut(BaseModel):
+    bid_id: str
+    carrier_id: str
+    event: str
+    amount_cents: int
+    actor: str
+    created_at: datetime
+
+
+class BidEventsOut(BaseModel):
+    events: List[BidEventOut]
+
+
+class AuctionOut(BaseModel):
+    load_id: str
+    load_status: str
+    auction_status: Optional[str] = None
+    bid_deadline: Optional[datetime] = None
+    reserve_cents: Optional[int] = None  # shipper only
+    bids: int
+    best_amount_cents: Optional[int] = None
+    awarded_bid_id: Optional[str] = None
+
+
 class ChatIn(BaseModel):
     content: str = Field(min_length=1, max_length=2000)
 
@@ -0,0 +1,34 @@
+import json
+import logging
+from typing import Any, Dict
+
+import redis
+from superapp_shared.redis_pool import get_redis
+
+from ..config import settings
+
+
+log = logging.getLogger(__name__)
+
+
+def _redis_client() -> redis.Redis | None:
+    # Pooled client shared across publishes (one pool per URL per process)
+    return get_redis(settings.REDIS_URL)
+
+
+def notify(event: str, payload: Dict[str, Any]) -> None:
+    mode = getattr(settings, "NOTIFY_MODE", "log")
+    if mode == "redis":
+        chan = getattr(settings, "NOTIFY_REDIS_CHANNEL", "freight.events")
+        cli = _redis_client()
+        if cli is None:
+            log.warning("notify(redis): no client available; falling back to log")
+        else:
+            try:
+                cli.publish(chan, json.dumps({"event": event, "data": payload}))
+                return
+            except Exception as e:
+                log.warning("notify(redis) failed: %s", e)
+    # default: log
+    log.info("event=%s payload=%s", event, payload)
+
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark load matching (app.matching).
+
+Usage:
+  DB_URL=postgresql+psycopg2://... python apps/freight/scripts/bench_matching.py \
+      [--loads 100000] [--carriers 10000] [--check 200] [--push 200]
+
+Seeds ``--loads`` open loads between random points of a Syria-sized box and
+``--carriers`` carriers with a location and capacity in it, then:
+
+* builds the in-memory index from the DB (full refresh);
+* ranks the top 20 loads for every carrier and reports matches/s and how many
+  loads were scored per carrier;
+* checks ``--check`` carriers against a brute-force scan of every open load;
+* posts-and-pushes ``--push`` new loads to nearby carriers;
+* times a few rankings the brute-force way (score the whole board) and the
+  old ``/carrier/loads/available`` query for comparison.
+
+Seeded rows are left in place; use a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert, select, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs", "superapp_shared"))
+
+if not os.getenv("DB_URL"):
+    print("Set DB_URL env to point to a scratch freight database", file=sys.stderr)
+    sys.exit(2)
+
+from app import matching  # type: ignore  # noqa: E402
+from app.config import settings  # type: ignore  # noqa: E402
+from app.database import SessionLocal, engine  # type: ignore  # noqa: E402
+from app.models import Base, CarrierLocation, CarrierProfile, Load, User  # type: ignore  # noqa: E402
+
+BOX = (32.3, 35.7, 37.3, 42.0)  # min_lat, min_lon, max_lat, max_lon
+CAPACITIES = (None, 3500, 8000, 12000, 24000)
+
+
+def _point(rnd: random.Random):
+    return rnd.uniform(BOX[0], BOX[2]), rnd.uniform(BOX[1], BOX[3])
+
+
+def _seed(rnd: random.Random, n_loads: int, n_carriers: int):
+    now = datetime.utcnow()
+    shipper = uuid.uuid4()
+    carriers = []
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [{"id": shipper, "phone": f"bench-{shipper.hex[:20]}", "role": "shipper", "created_at": now}])
+        for start in range(0, n_loads, 10000):
+            rows = []
+            for _ in range(start, min(n_loads, start + 10000)):
+                (olat, olon), (dlat, dlon) = _point(rnd), _point(rnd)
+                rows.append({
+                    "id": uuid.uuid4(), "shipper_user_id": shipper, "status": "posted", "origin": "bench", "destination": "bench",
+                    "weight_kg": rnd.randrange(500, 24000), "price_cents": rnd.randrange(20_000, 2_000_000), "created_at": now,
+                    "origin_lat": olat, "origin_lon": olon, "dest_lat": dlat, "dest_lon": dlon,
+                    "trip_km": max(1.0, matching.road_km(olat, olon, dlat, dlon)),
+                })
+            conn.execute(insert(Load.__table__), rows)
+        for start in range(0, n_carriers, 5000):
+            users, profiles, locs = [], [], []
+            for _ in range(start, min(n_carriers, start + 5000)):
+                uid, cid = uuid.uuid4(), uuid.uuid4()
+                lat, lon = _point(rnd)
+                cap = rnd.choice(CAPACITIES)
+                users.append({"id": uid, "phone": f"bench-{uid.hex[:20]}", "role": "carrier", "created_at": now})
+                profiles.append({"id": cid, "user_id": uid, "status": "approved", "capacity_kg": cap, "created_at": now})
+                loc = CarrierLocation(carrier_id=cid, lat=lat, lon=lon)
+                matching.set_carrier_cell(loc)
+                locs.append({"id": uuid.uuid4(), "carrier_id": cid, "lat": lat, "lon": lon, "cell": loc.cell, "updated_at": now})
+                carriers.append((cid, lat, lon, cap))
+            conn.execute(insert(User.__table__), users)
+            conn.execute(insert(CarrierProfile.__table__), profiles)
+            conn.execute(insert(CarrierLocation.__table__), locs)
+        for t in ("loads", "users", "carrier_profiles", "carrier_locations"):
+            conn.execute(text(f"ANALYZE {t}"))
+    return shipper, carriers
+
+
+def _brute(board, lat, lon, cap, limit=20):
+    max_dh = settings.FREIGHT_MATCH_MAX_DEADHEAD_KM
+    out = []
+    for lid, la, lo, w, p, trip in board:
+        if cap and w > cap:
+            continue
+        dh = matching.road_km(lat, lon, la, lo)
+        if dh <= max_dh:
+            out.append((-matching.score(dh, trip, p, w, cap)[0], lid))
+    return [lid for _, lid in sorted(out)[:limit]]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--loads", type=int, default=100_000)
+    ap.add_argument("--carriers", type=int, default=10_000)
+    ap.add_argument("--check", type=int, default=200)
+    ap.add_argument("--push", type=int, default=200)
+    ap.add_argument("--legacy-sample", type=int, default=20)
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random(44)
+    t0 = time.perf_counter()
+    shipper, carriers = _seed(rnd, args.loads, args.carriers)
+    print(f"seeded {args.loads:,} loads and {args.carriers:,} carriers in {time.perf_counter() - t0:.1f}s")
+
+    idx = matching.LoadIndex()
+    with SessionLocal() as db:
+        t0 = time.perf_counter()
+        n = idx.refresh(db, full=True)
+        print(f"index   : full refresh of {n:,} open loads in {time.perf_counter() - t0:.2f}s")
+
+        t0 = time.perf_counter()
+        found = 0
+        for _, lat, lon, cap in carriers:
+            found += len(idx.rank(lat, lon, cap, limit=20))
+        secs = time.perf_counter() - t0
+        print(
+            f"rank    : {len(carriers):,} carriers in {secs:.2f}s ({len(carriers) / secs:,.0f} matches/s, "
+            f"{secs / len(carriers) * 1000:.2f} ms each), {found / len(carriers):.1f} results, "
+            f"{idx.scored / len(carriers):,.0f} of {len(idx):,} loads scored per carrier"
+        )
+
+        board = [
+            (str(r[0]), r[1], r[2], r[3], r[4], r[5])
+            for r in db.execute(select(Load.id, Load.origin_lat, Load.origin_lon, Load.weight_kg, Load.price_cents, Load.trip_km).where(Load.status == "posted", Load.trip_km.is_not(None)))
+        ]
+        sample = rnd.sample(carriers, min(args.check, len(carriers)))
+        t0 = time.perf_counter()
+        for _, lat, lon, cap in sample:
+            assert [m.load_id for m in idx.rank(lat, lon, cap, limit=20)] == _brute(board, lat, lon, cap), (lat, lon, cap)
+        secs = time.perf_counter() - t0
+        print(f"check   : {len(sample)} carriers identical to a full scan; full scan {secs / max(1, len(sample)) * 1000:.1f} ms each")
+
+        if args.legacy_sample:
+            t0 = time.perf_counter()
+            for _ in range(args.legacy_sample):
+                db.query(Load).filter(Load.status == "posted").order_by(Load.created_at.desc()).limit(100).all()
+                db.expunge_all()
+            secs = time.perf_counter() - t0
+            print(f"legacy  : /carrier/loads/available query {secs / args.legacy_sample * 1000:.1f} ms each (newest 100, unranked)")
+
+        notified = 0
+        t0 = time.perf_counter()
+        for _ in range(args.push):
+            (olat, olon), (dlat, dlon) = _point(rnd), _point(rnd)
+            load = Load(shipper_user_id=shipper, origin="bench", destination="bench", weight_kg=rnd.randrange(500, 24000), price_cents=rnd.randrange(20_000, 2_000_000))
+            matching.locate(load, olat, olon, dlat, dlon)
+            db.add(load)
+            db.commit()
+            idx.add_load(load)
+            notified += len(matching.push_new_load(db, load))
+        secs = time.perf_counter() - t0
+        print(
+            f"push    : {args.push} new loads posted and pushed in {secs:.2f}s ({secs / max(1, args.push) * 1000:.1f} ms each), "
+            f"{notified / max(1, args.push):.1f} carriers notified per load"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import random
+import uuid
+
+from app import matching
+from app.geocode import geocode, normalize
+
+
+def test_geocode_names_aliases_and_coordinates():
+    assert geocode("Damascus, Syria").name == "Damascus"
+    assert geocode("حلب").name == "Aleppo"
+    assert geocode("الرقة").name == "Raqqa"
+    assert geocode("Al Raqqa").name == "Raqqa"
+    assert geocode("DEIR EZ-ZOR industrial zone").name == "Deir ez-Zor"
+    assert geocode("Homs industrial city").name == "Homs"
+    p = geocode("33.5, 36.3")
+    assert (p.lat, p.lon) == (33.5, 36.3)
+    assert geocode("Atlantis") is None and geocode("") is None
+    assert normalize("Lattakia Port!") == "lattakia port"
+
+
+def test_rank_prefers_short_deadhead_high_rate_and_full_truck():
+    idx = matching.LoadIndex(cell_deg=0.1)
+    homs = (34.7324, 36.7137)
+    # same trip and price: nearer origin wins
+    idx.add("near", 34.75, 36.72, 9000, 100000, 200.0)
+    idx.add("far", 35.30, 36.75, 9000, 100000, 200.0)
+    # same origin as "near" but half the truck: ranks below it
+    idx.add("light", 34.75, 36.72, 4500, 100000, 200.0)
+    # too heavy for the truck, and beyond the deadhead limit
+    idx.add("heavy", 34.74, 36.71, 20000, 900000, 200.0)
+    idx.add("remote", 36.20, 37.13, 1000, 900000, 50.0)
+    ranked = idx.rank(*homs, capacity_kg=10000, limit=10, max_deadhead_km=100)
+    assert [m.load_id for m in ranked] == ["near", "light", "far"]
+    assert ranked[0].capacity_fit == 0.9 and ranked[0].deadhead_km < ranked[2].deadhead_km
+    # unknown capacity: every weight fits fully, so only rate matters
+    assert [m.load_id for m in idx.rank(*homs, limit=1, max_deadhead_km=100)] == ["heavy"]
+    idx.discard(["heavy"])
+    assert "heavy" not in [m.load_id for m in idx.rank(*homs, max_deadhead_km=100)]
+
+
+def test_rank_matches_brute_force():
+    rnd = random.Random(7)
+    idx = matching.LoadIndex(cell_deg=0.1)
+    loads = []
+    for _ in range(3000):
+        lid = str(uuid.uuid4())
+        row = (lid, rnd.uniform(32.5, 37.0), rnd.uniform(35.7, 41.0), rnd.randrange(500, 24000), rnd.randrange(20000, 500000), rnd.uniform(20, 800))
+        idx.add(*row)
+        loads.append(row)
+    for _ in range(25):
+        lat, lon, cap = rnd.uniform(33, 36.5), rnd.uniform(36, 40), rnd.choice([None, 8000, 24000])
+        expected = []
+        for lid, la, lo, w, p, trip in loads:
+            dh = matching.road_km(lat, lon, la, lo)
+            if (cap and w > cap) or dh > 250:
+                continue
+            expected.append((-matching.score(dh, trip, p, w, cap)[0], lid))
+        expected = [lid for _, lid in sorted(expected)[:10]]
+        assert [m.load_id for m in idx.rank(lat, lon, cap, limit=10, max_deadhead_km=250)] == expected
+    # branch-and-bound scores a fraction of the board
+    assert idx.scored < 25 * len(loads) / 4
@@ -41,6 +41,8 @@ class Settings:
     PAYMENTS_BASE_URL: str = os.getenv("PAYMENTS_BASE_URL", "")
     PAYMENTS_INTERNAL_SECRET: str = os.getenv("PAYMENTS_INTERNAL_SECRET", "")
     PAYMENTS_WEBHOOK_SECRET: str = os.getenv("PAYMENTS_WEBHOOK_SECRET", "")
+    # Inbound Payments webhooks: PAYMENTS_WEBHOOK_SECRET may list "current,previous" during rotation
+    WEBHOOK_TOLERANCE_SECS: int = int(os.getenv("WEBHOOK_TOLERANCE_SECS", "300"))
 
     @property
     def jwt_expires_delta(self) -> timedelta:
@@ -23,6 +23,7 @@ from .routers import applications as applications_router
 from .routers import webhooks as webhooks_router
 from .routers import payments_webhook as payments_webhook_router
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from superapp_shared.redis_pool import install_redis_lifecycle
 import threading, time
 import httpx
 
@@ -127,6 +128,9 @@ def create_app() -> FastAPI:
     def metrics():
         return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
+    # Shared Redis pools (notify publisher): warm on startup, close on shutdown
+    install_redis_lifecycle(app, settings.REDIS_URL)
+
     app.include_router(auth_router.router)
     app.include_router(employer_router.router)
     app.include_router(jobs_router.router)
@@ -1,35 +1,23 @@
-import hmac
-import hashlib
-import json
-from fastapi import APIRouter, Header, HTTPException, status
+from fastapi import APIRouter, Request
+
+from superapp_shared.webhook_inbox import WebhookInbox, parse_secrets, register_prometheus_collector, webhook_inbox_store_from_env
 
 from ..config import settings
+from ..database import engine
 
 
 router = APIRouter(prefix="/payments", tags=["payments-webhook"])
 
-
-def _verify(ts: str, event: str, body: bytes, sign: str) -> bool:
-    secret = getattr(settings, "PAYMENTS_WEBHOOK_SECRET", None)
-    if not secret:
-        return False
-    expect = hmac.new(secret.encode("utf-8"), (ts + event).encode("utf-8") + body, hashlib.sha256).hexdigest()
-    try:
-        return hmac.compare_digest(expect, sign)
-    except Exception:
-        return False
+# Jobs currently does not track payment state: events are verified, recorded once and acked.
+inbox = WebhookInbox(
+    "jobs",
+    webhook_inbox_store_from_env(engine),
+    secrets=lambda: parse_secrets(settings.PAYMENTS_WEBHOOK_SECRET),
+    tolerance_secs=settings.WEBHOOK_TOLERANCE_SECS,
+)
+register_prometheus_collector()
 
 
 @router.post("/webhooks")
-def receive_webhook(
-    payload: dict,
-    ts: str | None = Header(default=None, alias="X-Webhook-Ts"),
-    event: str | None = Header(default=None, alias="X-Webhook-Event"),
-    sign: str | None = Header(default=None, alias="X-Webhook-Sign"),
-):
-    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
-    if not ts or not event or not sign or not _verify(ts, event, raw, sign):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid signature")
-    # Jobs currently does not track payment state; accept and ack.
-    return {"detail": "ok"}
-
+async def receive_webhook(request: Request):
+    return await inbox.receive_request(request)
@@ -21,6 +21,33 @@ from .routers import market as market_router
 from .routers import payments_webhook as payments_webhook_router
 from .routers import admin as admin_router
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, store_from_env
+
+
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler retrying inbound Payments webhooks whose handler failed (dead-lettered after WEBHOOK_MAX_ATTEMPTS) and payment handoffs."""
+    from .payment_saga import saga
+    from .routers.payments_webhook import inbox
+
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="livestock", **kw)
+
+    def _webhooks(ctx):
+        out = inbox.process_due()
+        out["gc_deleted"] = inbox.gc()
+        return out
+
+    secs = settings.WEBHOOK_RETRY_SWEEP_SECS
+    sched.add_job(
+        "livestock_webhook_retry", _webhooks, IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+
+    secs = settings.PAYMENT_SAGA_SWEEP_SECS
+    sched.add_job(
+        "livestock_payment_saga", lambda ctx: saga.process_due(), IntervalTrigger(max(secs, 1)),
+        lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    return sched
 
 
 def create_app() -> FastAPI:
@@ -103,6 +130,9 @@ def create_app() -> FastAPI:
     app.include_router(market_router.router)
     app.include_router(payments_webhook_router.router)
     app.include_router(admin_router.router)
+
+    if settings.WEBHOOK_RETRY_SWEEP_SECS > 0 or settings.PAYMENT_SAGA_SWEEP_SECS > 0:
+        install_scheduler(app, build_scheduler())
     return app
 
 
@@ -0,0 +1,57 @@
+"""Payment handoff for marketplace orders (see ``superapp_shared.payment_saga``).
+
+The saga row is written with the order and the stock it takes, sent right
+after the commit and retried by the ``livestock_payment_saga`` job. If
+Payments never takes the request, the order is canceled and the animal goes
+back on sale (or the product quantity is restored).
+"""
+from __future__ import annotations
+
+import uuid
+
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+
+from superapp_shared.payment_saga import PaymentSaga, SagaRecord, register_prometheus_collector
+
+from .config import settings
+from .database import SessionLocal
+from .models import AnimalListing, Order, ProductListing
+
+saga = PaymentSaga(
+    "livestock",
+    SessionLocal,
+    base_url=lambda: settings.PAYMENTS_BASE_URL,
+    secret=lambda: settings.PAYMENTS_INTERNAL_SECRET,
+    max_attempts=settings.PAYMENT_SAGA_MAX_ATTEMPTS,
+)
+register_prometheus_collector()
+
+
+@saga.on_requested("order")
+def _requested(db: Session, rec: SagaRecord):
+    linked = db.execute(
+        update(Order).where(Order.id == uuid.UUID(rec.ref_id), Order.status != "canceled")
+        .values(payment_request_id=rec.payment_request_id).execution_options(synchronize_session=False)
+    ).rowcount
+    # Canceled while the request was in flight: have the saga withdraw it
+    return bool(linked)
+
+
+@saga.on_failed("order")
+def _release(db: Session, rec: SagaRecord) -> None:
+    o = db.execute(select(Order).where(Order.id == uuid.UUID(rec.ref_id)).with_for_update()).scalars().first()
+    # Paid or canceled meanwhile: leave it alone
+    if o is None or o.status != "created":
+        return
+    if o.animal_id is not None:
+        db.execute(update(AnimalListing).where(AnimalListing.id == o.animal_id, AnimalListing.status == "sold").values(status="available"))
+    if o.product_id is not None:
+        db.execute(
+            update(ProductListing).where(ProductListing.id == o.product_id)
+            .values(
+                quantity=ProductListing.quantity + o.qty,
+                status=case((ProductListing.status == "sold_out", "active"), else_=ProductListing.status),
+            )
+        )
+    o.status = "canceled"
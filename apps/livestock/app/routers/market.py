@@ -1,7 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
-import httpx
 
 from ..auth import get_current_user
 from ..database import get_db
@@ -21,7 +20,7 @@ from ..schemas import (
 )
 from ..utils import notify
 from ..config import settings
-from superapp_shared.internal_hmac import sign_internal_request_headers
+from ..payment_saga import saga as payment_saga
 
 
 router = APIRouter(prefix="/market", tags=["market"]) 
@@ -89,6 +88,20 @@ def animal_details(animal_id: UUID, db: Session = Depends(get_db)):
     return AnimalOut(id=str(a.id), ranch_id=str(a.ranch_id), species=a.species, breed=a.breed, sex=a.sex, age_months=a.age_months, weight_kg=a.weight_kg, price_cents=a.price_cents, status=a.status, created_at=a.created_at)
 
 
+def _begin_payment(db: Session, o: Order, user: User) -> None:
+    """Payments request for the order, recorded with it so an outage retries it instead of losing it; commits."""
+    saga_id = None
+    if o.total_cents > 0 and payment_saga.enabled:
+        saga_id = payment_saga.begin(
+            db, "order", o.id, from_phone=user.phone, to_phone=settings.FEE_WALLET_PHONE, amount_cents=o.total_cents,
+            metadata={"order_id": str(o.id), "service": "livestock"},
+        )
+    db.commit()
+    if saga_id:
+        payment_saga.dispatch(saga_id)
+        db.refresh(o)
+
+
 @router.post("/animals/{animal_id}/order", response_model=OrderOut)
 def order_animal(animal_id: UUID, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     a = db.get(AnimalListing, animal_id)
@@ -98,19 +111,7 @@ def order_animal(animal_id: UUID, user: User = Depends(get_current_user), db: Se
     db.add(o)
     a.status = "sold"
     db.flush()
-    # Optional Payments handoff
-    try:
-        if settings.PAYMENTS_BASE_URL and settings.PAYMENTS_INTERNAL_SECRET and o.total_cents > 0:
-            to_phone = settings.FEE_WALLET_PHONE
-            payload_json = {"from_phone": user.phone, "to_phone": to_phone, "amount_cents": o.total_cents}
-            headers = sign_internal_request_headers(payload_json, settings.PAYMENTS_INTERNAL_SECRET, "")
-            with httpx.Client(timeout=5.0) as client:
-                r = client.post(f"{settings.PAYMENTS_BASE_URL}/internal/requests", headers=headers, json=payload_json)
-                if r.status_code < 400:
-                    o.payment_request_id = r.json().get("id")
-                    db.flush()
-    except Exception:
-        pass
+    _begin_payment(db, o, user)
     notify("order.created", {"order_id": str(o.id), "type": "animal", "animal_id": str(a.id)})
     return OrderOut(id=str(o.id), type=o.type, product_id=None, animal_id=str(o.animal_id), qty=o.qty, total_cents=o.total_cents, status=o.status, created_at=o.created_at)
 
@@ -189,22 +190,23 @@ def order_product(product_id: UUID, payload: OrderCreateIn, user: User = Depends
     if p.quantity <= 0:
         p.status = "sold_out"
     db.flush()
-    try:
-        if settings.PAYMENTS_BASE_URL and settings.PAYMENTS_INTERNAL_SECRET and total > 0:
-            to_phone = settings.FEE_WALLET_PHONE
-            payload_json = {"from_phone": user.phone, "to_phone": to_phone, "amount_cents": o.total_cents}
-            headers = sign_internal_request_headers(payload_json, settings.PAYMENTS_INTERNAL_SECRET, "")
-            with httpx.Client(timeout=5.0) as client:
-                r = client.post(f"{settings.PAYMENTS_BASE_URL}/internal/requests", headers=headers, json=payload_json)
-                if r.status_code < 400:
-                    o.payment_request_id = r.json().get("id")
-                    db.flush()
-    except Exception:
-        pass
+    _begin_payment(db, o, user)
     notify("order.created", {"order_id": str(o.id), "type": "product", "product_id": str(p.id)})
     return OrderOut(id=str(o.id), type=o.type, product_id=str(o.product_id), animal_id=None, qty=o.qty, total_cents=o.total_cents, status=o.status, created_at=o.created_at)
 
 
+@router.get("/orders/{order_id}/payment")
+def order_payment(order_id: UUID, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Where the payment handoff stands: pending (being retried), requested, compensated (stock released) or canceled."""
+    o = db.get(Order, order_id)
+    if not o or o.buyer_user_id != user.id:
+        raise HTTPException(status_code=404, detail="Order not found")
+    rec = payment_saga.status(db, "order", o.id)
+    if rec is not None:
+        return rec.to_dict()
+    return {"status": "requested" if o.payment_request_id else "none", "payment_request_id": o.payment_request_id, "amount_cents": o.total_cents, "attempts": 0, "next_attempt_at": None}
+
+
 @router.get("/orders", response_model=OrdersListOut)
 def my_orders(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     rows = db.query(Order).filter(Order.buyer_user_id == user.id).order_by(Order.created_at.desc()).all()
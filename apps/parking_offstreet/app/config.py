@@ -32,6 +32,11 @@ class Settings:
     PAYMENTS_INTERNAL_SECRET: str = os.getenv("PAYMENTS_INTERNAL_SECRET", "")
     FEE_WALLET_PHONE: str = os.getenv("FEE_WALLET_PHONE", "+963000000000")
     PAYMENTS_WEBHOOK_SECRET: str = os.getenv("PAYMENTS_WEBHOOK_SECRET", "")
+    # Facility lookup grid and live occupancy overlay (app/geo.py)
+    GEO_CELL_DEG: float = float(os.getenv("GEO_CELL_DEG", "0.01"))
+    FACILITY_NEAR_MAX_M: int = int(os.getenv("FACILITY_NEAR_MAX_M", "20000"))
+    FACILITY_OCCUPANCY_CACHE_SECS: float = float(os.getenv("FACILITY_OCCUPANCY_CACHE_SECS", "15"))
+    FACILITY_OCCUPANCY_STALE_SECS: int = int(os.getenv("FACILITY_OCCUPANCY_STALE_SECS", "300"))
 
     @property
     def jwt_expires_delta(self) -> timedelta:
@@ -0,0 +1,127 @@
+"""Indexed facility lookup and the live occupancy overlay behind ``/facilities/near``.
+
+Facilities carry the grid cell of their location (``facilities.cell``,
+indexed). A lookup probes the cells around the point, widening until it has
+``limit`` facilities within range or reaches ``FACILITY_NEAR_MAX_M``, and
+computes exact distances only for those rows.
+
+Occupancy is the operator/sensor count when it was reported within
+``FACILITY_OCCUPANCY_STALE_SECS``, otherwise open entries plus reservations
+holding a space right now. Counts are cached per facility for
+``FACILITY_OCCUPANCY_CACHE_SECS`` and computed with one grouped query for the
+uncached candidates.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.orm import Session
+from superapp_shared.cache import BoundedTTLCache
+from superapp_shared.geo import cell_id, cells_around, haversine_m
+
+from .config import settings
+from .models import Entry, Facility, Reservation
+
+
+NEAR_STEPS_M = (1000, 5000)
+
+_occupancy = BoundedTTLCache("parking_facility_occupancy", maxsize=20_000, ttl=settings.FACILITY_OCCUPANCY_CACHE_SECS)
+
+
+@dataclass
+class Occupancy:
+    capacity: Optional[int]
+    occupied: int
+    source: str  # live|derived
+
+    @property
+    def free(self) -> Optional[int]:
+        return None if self.capacity is None else max(0, self.capacity - self.occupied)
+
+    @property
+    def ratio(self) -> Optional[float]:
+        if not self.capacity:
+            return None
+        return min(1.0, self.occupied / self.capacity)
+
+
+def backfill_cells(db: Session) -> int:
+    """Set ``cell`` on facilities written before the grid index (the ORM keeps it current afterwards)."""
+    rows = db.execute(select(Facility.id, Facility.lat, Facility.lon).where(Facility.cell.is_(None))).all()
+    for fid, lat, lon in rows:
+        db.execute(update(Facility).where(Facility.id == fid).values(cell=cell_id(lat, lon, settings.GEO_CELL_DEG)))
+    db.commit()
+    return len(rows)
+
+
+def near_facilities(db: Session, lat: float, lon: float, limit: int = 20, max_m: Optional[int] = None) -> List[Tuple[Facility, float]]:
+    """Up to ``limit`` (facility, metres) pairs nearest first, within ``max_m``."""
+    max_m = settings.FACILITY_NEAR_MAX_M if max_m is None else max_m
+    for radius in [r for r in NEAR_STEPS_M if r < max_m] + [max_m]:
+        cells = cells_around(lat, lon, radius, settings.GEO_CELL_DEG)
+        rows = db.execute(select(Facility).where(Facility.cell.in_(cells))).scalars().all()
+        hits = sorted(
+            ((f, d) for f in rows for d in (haversine_m(lat, lon, f.lat, f.lon),) if d <= radius),
+            key=lambda x: x[1],
+        )
+        # Nearer facilities than the last one kept are all inside this radius, so the order is final
+        if len(hits) >= limit or radius >= max_m:
+            return hits[:limit]
+    return []
+
+
+def occupancy_for(db: Session, facilities: Iterable[Facility]) -> Dict[str, Occupancy]:
+    now = datetime.utcnow()
+    out: Dict[str, Occupancy] = {}
+    derive: List[Facility] = []
+    for f in facilities:
+        fresh = f.occupancy_updated_at and f.occupied_live is not None and now - f.occupancy_updated_at <= timedelta(seconds=settings.FACILITY_OCCUPANCY_STALE_SECS)
+        if fresh:
+            out[str(f.id)] = Occupancy(f.capacity, int(f.occupied_live), "live")
+            continue
+        cached = _occupancy.get(str(f.id))
+        if cached is not None:
+            out[str(f.id)] = Occupancy(f.capacity, cached, "derived")
+        else:
+            derive.append(f)
+    if derive:
+        ids = [f.id for f in derive]
+        counts: Dict[str, int] = {str(i): 0 for i in ids}
+        for fid, n in db.execute(
+            select(Entry.facility_id, func.count()).where(Entry.facility_id.in_(ids), Entry.stopped_at.is_(None)).group_by(Entry.facility_id)
+        ).all():
+            counts[str(fid)] += n
+        for fid, n in db.execute(
+            select(Reservation.facility_id, func.count())
+            .where(Reservation.facility_id.in_(ids), Reservation.status == "reserved", and_(Reservation.from_ts <= now, Reservation.to_ts > now))
+            .group_by(Reservation.facility_id)
+        ).all():
+            counts[str(fid)] += n
+        for f in derive:
+            _occupancy.set(str(f.id), counts[str(f.id)])
+            out[str(f.id)] = Occupancy(f.capacity, counts[str(f.id)], "derived")
+    return out
+
+
+def rank_by_availability(hits: List[Tuple[Facility, float]], occ: Dict[str, Occupancy]) -> List[Tuple[Facility, float]]:
+    """Full facilities last; otherwise distance stretched by how full the facility is (x1 empty .. x2 full)."""
+
+    def key(item: Tuple[Facility, float]):
+        o = occ.get(str(item[0].id))
+        full = o is not None and o.free == 0
+        ratio = (o.ratio if o is not None else None) or 0.0
+        return (full, item[1] * (1.0 + ratio))
+
+    return sorted(hits, key=key)
+
+
+def report_occupancy(db: Session, f: Facility, occupied: int, capacity: Optional[int] = None) -> None:
+    f.occupied_live = max(0, int(occupied))
+    f.occupancy_updated_at = datetime.utcnow()
+    if capacity is not None:
+        f.capacity = max(0, int(capacity))
+    _occupancy.delete(str(f.id))
+    db.flush()
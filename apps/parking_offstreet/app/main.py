@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from .config import settings
 from .database import engine, SessionLocal
 from .models import Base, Facility
+from .geo import backfill_cells
 from .routers import facilities as facilities_router
 from .routers import reservations as reservations_router
 from .routers import entries as entries_router
@@ -32,14 +33,21 @@ def startup():
                 conn.exec_driver_sql("ALTER TABLE reservations ADD COLUMN IF NOT EXISTS payment_transfer_id VARCHAR(64)")
                 conn.exec_driver_sql("ALTER TABLE entries ADD COLUMN IF NOT EXISTS payment_request_id VARCHAR(64)")
                 conn.exec_driver_sql("ALTER TABLE entries ADD COLUMN IF NOT EXISTS payment_transfer_id VARCHAR(64)")
+                conn.exec_driver_sql("ALTER TABLE facilities ADD COLUMN IF NOT EXISTS cell BIGINT")
+                conn.exec_driver_sql("ALTER TABLE facilities ADD COLUMN IF NOT EXISTS capacity INTEGER")
+                conn.exec_driver_sql("ALTER TABLE facilities ADD COLUMN IF NOT EXISTS occupied_live INTEGER")
+                conn.exec_driver_sql("ALTER TABLE facilities ADD COLUMN IF NOT EXISTS occupancy_updated_at TIMESTAMP")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_facility_cell ON facilities (cell)")
+                conn.commit()
         except Exception:
             pass
     db: Session = SessionLocal()
     try:
         if db.query(Facility).count() == 0:
-            f = Facility(name="City Garage A", lat=33.5100, lon=36.2750, height_limit_m=2.1)
+            f = Facility(name="City Garage A", lat=33.5100, lon=36.2750, height_limit_m=2.1, capacity=120)
             db.add(f)
             db.commit()
+        backfill_cells(db)
     finally:
         db.close()
 
@@ -1,6 +1,9 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, ForeignKey, Index, Float, UniqueConstraint
+from sqlalchemy import BigInteger, Column, String, Integer, DateTime, Boolean, ForeignKey, Index, Float, UniqueConstraint, event
+from superapp_shared.geo import cell_id
+
+from .config import settings
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base, relationship
 
@@ -14,7 +17,10 @@ def default_uuid():
 
 class Facility(Base):
     __tablename__ = "facilities"
-    __table_args__ = (Index("ix_facility_name", "name"),)
+    __table_args__ = (
+        Index("ix_facility_name", "name"),
+        Index("ix_facility_cell", "cell"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     operator_id = Column(UUID(as_uuid=True), nullable=True)
@@ -23,6 +29,19 @@ class Facility(Base):
     lon = Column(Float, nullable=False)
     height_limit_m = Column(Float, nullable=True)
     opening_hours_json = Column(String(4096), nullable=True)
+    # Grid cell of (lat, lon) for the indexed /facilities/near lookup; kept in sync on write
+    cell = Column(BigInteger, nullable=True)
+    capacity = Column(Integer, nullable=True)
+    # Operator/sensor reported occupancy; trusted for FACILITY_OCCUPANCY_STALE_SECS
+    occupied_live = Column(Integer, nullable=True)
+    occupancy_updated_at = Column(DateTime, nullable=True)
+
+
+@event.listens_for(Facility, "before_insert")
+@event.listens_for(Facility, "before_update")
+def _facility_cell(mapper, connection, target):
+    if target.lat is not None and target.lon is not None:
+        target.cell = cell_id(target.lat, target.lon, settings.GEO_CELL_DEG)
 
 
 class Reservation(Base):
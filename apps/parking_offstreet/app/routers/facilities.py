@@ -1,22 +1,13 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from math import radians, cos, sin, asin, sqrt
 from ..auth import get_current_user, get_db
-from ..models import Facility
+from ..geo import near_facilities, occupancy_for, rank_by_availability
 
 
 router = APIRouter(prefix="/facilities", tags=["facilities"])
 
 
-def _hk(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    d_lat = radians(lat2 - lat1)
-    d_lon = radians(lon2 - lon1)
-    a = sin(d_lat/2)**2 + cos(radians(lat1))*cos(radians(lat2))*sin(d_lon/2)**2
-    return 2*asin(sqrt(a))*R
-
-
 class FacilityOut(BaseModel):
     id: str
     name: str
@@ -24,15 +15,35 @@ class FacilityOut(BaseModel):
     lon: float
     height_limit_m: float | None = None
     distance_m: int
+    capacity: int | None = None
+    occupied: int | None = None
+    free_spaces: int | None = None
+    occupancy_source: str | None = None  # live (operator/sensor feed) | derived (open entries + reservations)
 
 
 @router.get("/near", response_model=list[FacilityOut])
-def near(lat: float, lon: float, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    rows = db.query(Facility).all()
+def near(
+    lat: float,
+    lon: float,
+    limit: int = Query(default=20, ge=1, le=100),
+    occupancy: bool = False,
+    rank: str = Query(default="distance", pattern="^(distance|availability)$"),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    # Grid-indexed candidates around the point (see app/geo.py), nearest first
+    hits = near_facilities(db, lat, lon, limit=limit)
+    occ = occupancy_for(db, [f for f, _ in hits]) if (occupancy or rank == "availability") else {}
+    if rank == "availability":
+        hits = rank_by_availability(hits, occ)
     out = []
-    for f in rows:
-        dist = int(_hk(lat, lon, f.lat, f.lon) * 1000)
-        out.append(FacilityOut(id=str(f.id), name=f.name, lat=f.lat, lon=f.lon, height_limit_m=f.height_limit_m, distance_m=dist))
-    out.sort(key=lambda x: x.distance_m)
-    return out[:20]
-
+    for f, dist in hits:
+        o = occ.get(str(f.id))
+        out.append(FacilityOut(
+            id=str(f.id), name=f.name, lat=f.lat, lon=f.lon, height_limit_m=f.height_limit_m, distance_m=int(dist),
+            capacity=f.capacity,
+            occupied=o.occupied if o else None,
+            free_spaces=o.free if o else None,
+            occupancy_source=o.source if o else None,
+        ))
+    return out
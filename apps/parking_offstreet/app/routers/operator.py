@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 import httpx
 
 from ..auth import get_current_user, get_db
 from ..config import settings
-from ..models import Reservation, Entry
+from ..geo import report_occupancy
+from ..models import Facility, Reservation, Entry
 
 
 router = APIRouter(prefix="/operator", tags=["operator"])
@@ -45,3 +47,18 @@ def payment_status(request_id: str, db: Session = Depends(get_db), user=Depends(
         raise HTTPException(status_code=404, detail="request_not_found")
     return {"local": local, "remote": remote}
 
+
+
+class OccupancyIn(BaseModel):
+    occupied: int = Field(ge=0)
+    capacity: int | None = Field(default=None, ge=0)
+
+
+@router.put("/facilities/{facility_id}/occupancy")
+def put_occupancy(facility_id: str, payload: OccupancyIn, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    # Live count from gate counters / sensors; overrides the derived count while fresh
+    f = db.get(Facility, facility_id)
+    if f is None:
+        raise HTTPException(status_code=404, detail="facility_not_found")
+    report_occupancy(db, f, payload.occupied, payload.capacity)
+    return {"id": str(f.id), "capacity": f.capacity, "occupied": f.occupied_live, "updated_at": f.occupancy_updated_at}
@@ -36,6 +36,21 @@ class Settings:
     INTERNAL_API_SECRET: str = os.getenv("INTERNAL_API_SECRET", "dev_ai_secret")
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://redis:6379/0")
     AI_GATEWAY_BASE_URL: str = os.getenv("AI_GATEWAY_BASE_URL", "http://localhost:8099")
+    # Zone lookup grid (app/geo.py); changing the cell size requires a reindex of zone_cells
+    GEO_CELL_DEG: float = float(os.getenv("GEO_CELL_DEG", "0.01"))
+    ZONE_NEAR_MAX_M: int = int(os.getenv("ZONE_NEAR_MAX_M", "5000"))
+    # Settlement stage (app/settlement.py): job interval (0 disables the scheduled run), batching, retries
+    SETTLEMENT_POLL_SECS: int = int(os.getenv("SETTLEMENT_POLL_SECS", "5"))
+    SETTLEMENT_RECONCILE_SECS: int = int(os.getenv("SETTLEMENT_RECONCILE_SECS", "300"))
+    SETTLEMENT_KICK: bool = env_bool("SETTLEMENT_KICK", default=True)
+    SETTLEMENT_BATCH: int = int(os.getenv("SETTLEMENT_BATCH", "100"))
+    SETTLEMENT_CONCURRENCY: int = int(os.getenv("SETTLEMENT_CONCURRENCY", "4"))
+    SETTLEMENT_LEASE_SECS: int = int(os.getenv("SETTLEMENT_LEASE_SECS", "60"))
+    SETTLEMENT_MAX_ATTEMPTS: int = int(os.getenv("SETTLEMENT_MAX_ATTEMPTS", "8"))
+    SETTLEMENT_RETRY_BASE_SECS: int = int(os.getenv("SETTLEMENT_RETRY_BASE_SECS", "10"))
+    SETTLEMENT_MEMBERSHIP_ATTEMPTS: int = int(os.getenv("SETTLEMENT_MEMBERSHIP_ATTEMPTS", "3"))
+    SETTLEMENT_OVERDUE_SECS: int = int(os.getenv("SETTLEMENT_OVERDUE_SECS", "3600"))
+    SCHEDULER_PARTITIONS: int = int(os.getenv("SCHEDULER_PARTITIONS", "4"))
 
     @property
     def jwt_expires_delta(self) -> timedelta:
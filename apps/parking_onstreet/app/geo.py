@@ -0,0 +1,155 @@
+"""Zone geometry and the indexed zone lookup behind ``/zones/near`` and session location checks.
+
+Each zone is stored in ``zone_cells`` under every grid cell its polygon (or
+its center/radius circle, for zones without one) overlaps, and carries its
+bounding box. A lookup probes the point's own cell for zones whose box holds
+the point, then tests those against the real shape; when none contains it,
+it widens to the cells around the point and returns the zone with the
+nearest edge. Only zones in those cells whose box is in range are loaded,
+whatever the size of the table.
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+from superapp_shared.cache import BoundedTTLCache
+from superapp_shared.geo import Polygon, bbox_around, cell_id, cells_around, haversine_m
+
+from .config import settings
+from .models import Zone, ZoneCell
+
+
+# Parsed polygons, keyed by (zone id, geometry_updated_at) so an update is never served stale
+_shapes = BoundedTTLCache("parking_zone_shapes", maxsize=50_000, ttl=3600)
+_NO_SHAPE = object()
+
+NEAR_STEPS_M = (250, 1000)
+
+
+@dataclass
+class ZoneMatch:
+    zone: Zone
+    inside: bool
+    distance_m: float
+
+
+def zone_shape(z: Zone) -> Optional[Polygon]:
+    if not z.polygon_geojson:
+        return None
+    shape = _shapes.get_or_load((z.id, z.geometry_updated_at), lambda: Polygon.from_geojson(z.polygon_geojson) or _NO_SHAPE)
+    return None if shape is _NO_SHAPE else shape
+
+
+def zone_distance_m(z: Zone, lat: float, lon: float) -> float:
+    """0 inside the zone, otherwise metres to its edge."""
+    shape = zone_shape(z)
+    if shape is not None:
+        return shape.distance_m(lat, lon)
+    return max(0.0, haversine_m(lat, lon, z.center_lat, z.center_lon) - (z.radius_m or 0))
+
+
+def zone_area_m2(z: Zone) -> float:
+    shape = zone_shape(z)
+    return shape.area_m2 if shape is not None else math.pi * float(z.radius_m or 0) ** 2
+
+
+def zone_bbox(z: Zone) -> Tuple[float, float, float, float]:
+    shape = zone_shape(z)
+    if shape is not None:
+        return shape.bbox
+    return bbox_around(z.center_lat, z.center_lon, max(1, z.radius_m or 0))
+
+
+def zone_cells(z: Zone, cell_deg: Optional[float] = None) -> List[int]:
+    cell_deg = cell_deg or settings.GEO_CELL_DEG
+    shape = zone_shape(z)
+    if shape is not None:
+        return shape.cells(cell_deg)
+    return cells_around(z.center_lat, z.center_lon, max(1, z.radius_m or 0), cell_deg)
+
+
+def set_geometry(db: Session, z: Zone, polygon_geojson: Optional[str]) -> None:
+    """Validate and store a zone polygon (None reverts to the circle), then reindex its cells."""
+    shape = Polygon.from_geojson(polygon_geojson) if polygon_geojson else None
+    z.polygon_geojson = polygon_geojson or None
+    z.geometry_updated_at = datetime.utcnow()
+    if shape is not None and (z.center_lat is None or z.center_lon is None):
+        z.center_lat = (shape.min_lat + shape.max_lat) / 2
+        z.center_lon = (shape.min_lon + shape.max_lon) / 2
+    index_zone(db, z)
+
+
+def _set_bbox(z: Zone) -> None:
+    z.bbox_min_lat, z.bbox_min_lon, z.bbox_max_lat, z.bbox_max_lon = zone_bbox(z)
+
+
+def index_zone(db: Session, z: Zone) -> int:
+    _set_bbox(z)
+    db.flush()
+    db.execute(delete(ZoneCell).where(ZoneCell.zone_id == z.id))
+    cells = zone_cells(z)
+    db.execute(insert(ZoneCell), [{"cell": c, "zone_id": z.id} for c in cells])
+    return len(cells)
+
+
+def reindex_zones(db: Session, only_missing: bool = True, batch: int = 1000) -> int:
+    """(Re)build ``zone_cells`` and bboxes; by default only for zones not indexed yet (startup backfill)."""
+    done = 0
+    after = None
+    while True:
+        q = select(Zone).order_by(Zone.id).limit(batch)
+        if after is not None:
+            q = q.where(Zone.id > after)
+        if only_missing:
+            q = q.where(Zone.bbox_min_lat.is_(None))
+        zones = db.execute(q).scalars().all()
+        if not zones:
+            return done
+        ids = [z.id for z in zones]
+        for z in zones:
+            _set_bbox(z)
+        db.flush()
+        db.execute(delete(ZoneCell).where(ZoneCell.zone_id.in_(ids)))
+        db.execute(insert(ZoneCell), [{"cell": c, "zone_id": z.id} for z in zones for c in zone_cells(z)])
+        db.commit()
+        done += len(zones)
+        after = ids[-1]
+
+
+def _zones_in(db: Session, cells: List[int], box: Tuple[float, float, float, float]) -> List[Zone]:
+    """Zones indexed under any of ``cells`` whose bounding box overlaps ``box``."""
+    if not cells:
+        return []
+    min_lat, min_lon, max_lat, max_lon = box
+    sub = select(ZoneCell.zone_id).where(ZoneCell.cell.in_(cells)).distinct()
+    q = select(Zone).where(
+        Zone.id.in_(sub),
+        Zone.bbox_min_lat <= max_lat, Zone.bbox_max_lat >= min_lat,
+        Zone.bbox_min_lon <= max_lon, Zone.bbox_max_lon >= min_lon,
+    )
+    return db.execute(q).scalars().all()
+
+
+def resolve_zone(db: Session, lat: float, lon: float, max_m: Optional[int] = None) -> Optional[ZoneMatch]:
+    """The zone containing the point (the smallest, where zones nest), else the nearest within ``max_m``."""
+    max_m = settings.ZONE_NEAR_MAX_M if max_m is None else max_m
+    # A little slack so points on a box edge still match after float rounding
+    here = _zones_in(db, [cell_id(lat, lon, settings.GEO_CELL_DEG)], bbox_around(lat, lon, 0.05))
+    here = [z for z in here if zone_distance_m(z, lat, lon) == 0]
+    if here:
+        return ZoneMatch(min(here, key=zone_area_m2), True, 0.0)
+    for radius in [r for r in NEAR_STEPS_M if r < max_m] + [max_m]:
+        best = None
+        for z in _zones_in(db, cells_around(lat, lon, radius, settings.GEO_CELL_DEG), bbox_around(lat, lon, radius)):
+            d = zone_distance_m(z, lat, lon)
+            if d <= radius and (best is None or d < best[1]):
+                best = (z, d)
+        if best is not None:
+            # Anything nearer is within this radius too, so it was a candidate of this step
+            return ZoneMatch(best[0], False, best[1])
+    return None
@@ -5,11 +5,39 @@ from sqlalchemy.orm import Session
 from .config import settings
 from .database import engine, SessionLocal
 from .models import Base, Zone, Tariff
+from .geo import reindex_zones
 from .routers import zones as zones_router
 from .routers import sessions as sessions_router
 from .routers import receipts as receipts_router
 from .routers import reminders as reminders_router
 from .routers import internal_tools as internal_tools_router
+from .routers import settlements as settlements_router
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, sql_partition_clause, store_from_env
+
+
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler running the settlement stage (one lease per partition of settlements) and its reconciliation."""
+    from .models import Settlement
+    from .settlement import reconcile, settle_due
+
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="parking_onstreet", **kw)
+
+    def _settle(ctx):
+        return settle_due(where=sql_partition_clause(Settlement.id, ctx), check=ctx.check).to_dict()
+
+    def _reconcile(ctx):
+        with SessionLocal() as db:
+            return reconcile(db)
+
+    secs = settings.SETTLEMENT_POLL_SECS
+    sched.add_job(
+        "parking_settlement", _settle, IntervalTrigger(max(secs, 1)),
+        partitions=settings.SCHEDULER_PARTITIONS, lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    rsecs = settings.SETTLEMENT_RECONCILE_SECS
+    sched.add_job("parking_settlement_reconcile", _reconcile, IntervalTrigger(max(rsecs, 1)), lease_secs=max(60, rsecs), enabled=rsecs > 0)
+    return sched
+
 
 app = FastAPI(title="Parking On‑Street")
 allowed_origins = settings.ALLOWED_ORIGINS or ["*"]
@@ -26,6 +54,14 @@ app.add_middleware(
 def on_startup():
     if settings.AUTO_CREATE_SCHEMA:
         Base.metadata.create_all(bind=engine)
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql("ALTER TABLE zones ADD COLUMN IF NOT EXISTS polygon_geojson TEXT")
+                conn.exec_driver_sql("ALTER TABLE zones ADD COLUMN IF NOT EXISTS geometry_updated_at TIMESTAMP")
+                for col in ("bbox_min_lat", "bbox_min_lon", "bbox_max_lat", "bbox_max_lon"):
+                    conn.exec_driver_sql(f"ALTER TABLE zones ADD COLUMN IF NOT EXISTS {col} DOUBLE PRECISION")
+        except Exception:
+            pass
     # Seed demo zone/tariff if empty
     db: Session = SessionLocal()
     try:
@@ -49,6 +85,8 @@ def on_startup():
             )
             db.add(t)
             db.commit()
+        # Zones created before the grid index (or by raw imports) get their cells and bbox
+        reindex_zones(db, only_missing=True)
     finally:
         db.close()
 
@@ -58,6 +96,11 @@ app.include_router(sessions_router.router)
 app.include_router(receipts_router.router)
 app.include_router(reminders_router.router)
 app.include_router(internal_tools_router.router)
+app.include_router(settlements_router.router)
+
+if settings.SETTLEMENT_POLL_SECS > 0 or settings.SETTLEMENT_RECONCILE_SECS > 0:
+    # Every replica may run the jobs; partition leases keep each settlement on one of them
+    install_scheduler(app, build_scheduler())
 
 @app.get("/health")
 def health():
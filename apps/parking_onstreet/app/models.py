@@ -9,6 +9,8 @@ from sqlalchemy import (
     ForeignKey,
     Index,
     Float,
+    BigInteger,
+    Text,
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base, relationship
@@ -41,6 +43,24 @@ class Zone(Base):
     center_lat = Column(Float, nullable=False)
     center_lon = Column(Float, nullable=False)
     radius_m = Column(Integer, nullable=False, default=500)
+    # GeoJSON Polygon; zones without one are the circle center/radius_m
+    polygon_geojson = Column(Text, nullable=True)
+    geometry_updated_at = Column(DateTime, nullable=True)
+    # Bounding box of the polygon/circle, written with the zone's cells; refines a cell probe in SQL
+    bbox_min_lat = Column(Float, nullable=True)
+    bbox_min_lon = Column(Float, nullable=True)
+    bbox_max_lat = Column(Float, nullable=True)
+    bbox_max_lon = Column(Float, nullable=True)
+
+
+class ZoneCell(Base):
+    """Grid cells (superapp_shared.geo.cell_id) overlapping a zone; the lookup index for /zones/near."""
+
+    __tablename__ = "zone_cells"
+    __table_args__ = (Index("ix_zone_cells_zone", "zone_id"),)
+
+    cell = Column(BigInteger, primary_key=True)
+    zone_id = Column(UUID(as_uuid=True), ForeignKey("zones.id", ondelete="CASCADE"), primary_key=True)
 
 
 class Tariff(Base):
@@ -87,7 +107,7 @@ class Session(Base):
     gross_cents = Column(Integer, nullable=True)
     fee_cents = Column(Integer, nullable=True)
     net_cents = Column(Integer, nullable=True)
-    status = Column(String(16), default="running")  # running|stopped|settled
+    status = Column(String(16), default="running")  # running|stopped|settled (stopped = settlement pending)
     escrow_transfer_id = Column(String(64), nullable=True)
     receipt_id = Column(String(64), nullable=True)
     auto_stopped_reason = Column(String(32), nullable=True)
@@ -109,6 +129,35 @@ class Receipt(Base):
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 
+class Settlement(Base):
+    """Durable settlement work item, written in the same transaction as the session stop (app/settlement.py)."""
+
+    __tablename__ = "settlements"
+    __table_args__ = (Index("ix_settlements_due", "status", "next_attempt_at"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.id"), nullable=False, unique=True)
+    user_id = Column(UUID(as_uuid=True), nullable=False)
+    phone = Column(String(32), nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending|settled|failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Lease of the worker processing it; writes are fenced on claim_token
+    claimed_until = Column(DateTime, nullable=True)
+    claim_token = Column(UUID(as_uuid=True), nullable=True)
+    last_error = Column(String(255), nullable=True)
+    # Frozen once priced, so a retry never re-prices
+    priced_at = Column(DateTime, nullable=True)
+    membership_tier = Column(String(32), nullable=True)
+    discount_pct = Column(Integer, nullable=True)
+    discount_cents = Column(Integer, nullable=True)
+    net_transfer_id = Column(String(64), nullable=True)
+    fee_transfer_id = Column(String(64), nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    settled_at = Column(DateTime, nullable=True)
+
+
 class Reminder(Base):
     __tablename__ = "reminders"
     __table_args__ = (Index("ix_reminders_session", "session_id"),)
@@ -1,13 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from datetime import datetime
 from ..auth import get_current_user, get_db
-from ..models import Session as ParkSession, Vehicle, Tariff, Receipt
-from ..pricing import compute_fee
-from ..settlement import settle_with_payments
+from ..models import Session as ParkSession, Settlement, Vehicle, Tariff
+from ..settlement import kick, stop_session
 from ..config import settings
-from math import radians, cos, sin, asin, sqrt
+from ..geo import zone_distance_m
 
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
@@ -50,70 +49,65 @@ def start(req: StartReq, db: Session = Depends(get_db), user=Depends(get_current
 
 class StopRes(BaseModel):
     id: str
-    minutes: int
-    gross_cents: int
-    fee_cents: int
-    net_cents: int
+    status: str  # stopped (settlement pending) | settled
+    settlement_status: str
+    # Filled in once the settlement stage has priced the session (see GET /sessions/{id}/settlement)
+    minutes: int | None = None
+    gross_cents: int | None = None
+    fee_cents: int | None = None
+    net_cents: int | None = None
 
 
 @router.post("/{sid}/stop", response_model=StopRes)
-async def stop(sid: str, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def stop(sid: str, background: BackgroundTasks, db: Session = Depends(get_db), user=Depends(get_current_user)):
     s = db.get(ParkSession, sid)
     if not s or s.user_id != user.id or s.status != "running":
         raise HTTPException(404, "session_invalid")
-    t = db.query(Tariff).filter(Tariff.zone_id == s.zone_id).first()
-    s.stopped_at = datetime.utcnow()
-    minutes, gross, fee, net = compute_fee(s.started_at, s.stopped_at, t)
-    # Membership discount (MVP): apply 5% discount on net if member has parking benefit
-    try:
-        import httpx
-        from ..config import settings
-        with httpx.Client(timeout=3.0) as client:
-            r = client.get(f"{settings.AI_GATEWAY_BASE_URL}/v1/membership/status", params={"user_id": str(user.id), "phone": user.phone})
-            if r.status_code < 400:
-                tier = (r.json() or {}).get("tier", "none")
-                bens = (r.json() or {}).get("benefits", []) or []
-                if tier in ("prime", "basic") and any(b.startswith("parking_discount") for b in bens):
-                    # find percentage from benefit name, default to 5
-                    perc = 5
-                    for b in bens:
-                        if b.startswith("parking_discount_"):
-                            try:
-                                perc = int(b.split("_")[-1])
-                            except Exception:
-                                pass
-                    discount = int(round(net * (perc / 100.0)))
-                    net = max(0, net - discount)
-    except Exception:
-        pass
-    s.minutes_billed, s.gross_cents, s.fee_cents, s.net_cents = minutes, gross, fee, net
-    s.status = "stopped"
-    # Create receipt if not exists
-    existing = db.query(Receipt).filter(Receipt.session_id == s.id).one_or_none()
-    if not existing:
-        r = Receipt(
-            session_id=s.id,
-            minutes=minutes,
-            gross_cents=gross,
-            fee_cents=fee,
-            net_cents=net,
-            currency=t.currency or "SYP",
-        )
-        db.add(r)
-    db.flush()
-    # Attempt settlement via Payments (best-effort)
-    try:
-        await settle_with_payments(
-            from_phone=user.phone,
-            operator_phone=settings.OPERATOR_PHONE,
-            fee_phone=settings.FEE_WALLET_PHONE,
-            net_cents=net,
-            fee_cents=fee,
-        )
-    except Exception:
-        # Do not fail stop; operator reconciliation can happen later
-        pass
-    return StopRes(id=str(s.id), minutes=minutes, gross_cents=gross, fee_cents=fee, net_cents=net)
+    # Pricing, membership discount and payment run in the settlement stage, not here
+    row = stop_session(db, s, user.phone)
+    db.commit()
+    if settings.SETTLEMENT_KICK:
+        background.add_task(kick, row.id)
+    return StopRes(id=str(s.id), status=s.status, settlement_status=row.status)
+
+
+class SettlementRes(BaseModel):
+    session_id: str
+    status: str  # pending|settled|failed
+    attempts: int
+    last_error: str | None = None
+    minutes: int | None = None
+    gross_cents: int | None = None
+    fee_cents: int | None = None
+    net_cents: int | None = None
+    discount_cents: int | None = None
+    net_transfer_id: str | None = None
+    fee_transfer_id: str | None = None
+    settled_at: datetime | None = None
+
+
+@router.get("/{sid}/settlement", response_model=SettlementRes)
+def settlement(sid: str, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    s = db.get(ParkSession, sid)
+    if not s or s.user_id != user.id:
+        raise HTTPException(404, "session_not_found")
+    st = db.query(Settlement).filter(Settlement.session_id == s.id).one_or_none()
+    if st is None:
+        raise HTTPException(404, "settlement_not_found")
+    return SettlementRes(
+        session_id=str(s.id),
+        status=st.status,
+        attempts=st.attempts,
+        last_error=st.last_error,
+        minutes=s.minutes_billed,
+        gross_cents=s.gross_cents,
+        fee_cents=s.fee_cents,
+        net_cents=s.net_cents,
+        discount_cents=st.discount_cents,
+        net_transfer_id=st.net_transfer_id,
+        fee_transfer_id=st.fee_transfer_id,
+        settled_at=st.settled_at,
+    )
 
 
 class MySession(BaseModel):
@@ -135,15 +129,6 @@ def my(status: str | None = None, db: Session = Depends(get_db), user=Depends(ge
     ]
 
 
-def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    R = 6371.0
-    d_lat = radians(lat2 - lat1)
-    d_lon = radians(lon2 - lon1)
-    a = sin(d_lat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(d_lon / 2) ** 2
-    c = 2 * asin(sqrt(a))
-    return R * c
-
-
 class LocReq(BaseModel):
     lat: float
     lon: float
@@ -157,52 +142,23 @@ class LocRes(BaseModel):
 
 
 @router.post("/{sid}/loc", response_model=LocRes)
-async def update_loc(sid: str, req: LocReq, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def update_loc(sid: str, req: LocReq, background: BackgroundTasks, db: Session = Depends(get_db), user=Depends(get_current_user)):
     s = db.get(ParkSession, sid)
     if not s or s.user_id != user.id or s.status != "running":
         raise HTTPException(404, "session_invalid")
-    # load zone center+radius via join on tariff -> session has zone_id
-    t = db.query(Tariff).filter(Tariff.zone_id == s.zone_id).first()
-    if not t:
-        # find zone anyway through a roundtrip
-        pass
-    # fetch zone center/radius
+    # fetch zone geometry
     from ..models import Zone
 
     z: Zone | None = db.get(Zone, s.zone_id)
     if not z:
         return LocRes(status="unknown")
-    dist_m = int(_haversine_km(req.lat, req.lon, z.center_lat, z.center_lon) * 1000)
-    allowed = z.radius_m + (req.buffer_m or 0)
-    if dist_m > allowed:
-        # auto stop
-        s.stopped_at = datetime.utcnow()
-        minutes, gross, fee, net = compute_fee(s.started_at, s.stopped_at, t)
-        s.minutes_billed, s.gross_cents, s.fee_cents, s.net_cents = minutes, gross, fee, net
-        s.status = "stopped"
-        s.auto_stopped_reason = "left_zone"
-        existing = db.query(Receipt).filter(Receipt.session_id == s.id).one_or_none()
-        if not existing:
-            r = Receipt(
-                session_id=s.id,
-                minutes=minutes,
-                gross_cents=gross,
-                fee_cents=fee,
-                net_cents=net,
-                currency=t.currency or "SYP",
-            )
-            db.add(r)
-        db.flush()
-        try:
-            await settle_with_payments(
-                from_phone=user.phone,
-                operator_phone=settings.OPERATOR_PHONE,
-                fee_phone=settings.FEE_WALLET_PHONE,
-                net_cents=net,
-                fee_cents=fee,
-            )
-        except Exception:
-            pass
+    # Distance outside the zone's polygon (or circle); 0 while inside
+    if zone_distance_m(z, req.lat, req.lon) > (req.buffer_m or 0):
+        # auto stop; settled like a manual stop
+        row = stop_session(db, s, user.phone, reason="left_zone")
+        db.commit()
+        if settings.SETTLEMENT_KICK:
+            background.add_task(kick, row.id)
         return LocRes(status="stopped", auto_stopped=True, reason="left_zone")
     return LocRes(status="running")
 
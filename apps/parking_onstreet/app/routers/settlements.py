@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from superapp_shared.internal_hmac import verify_internal_hmac_with_replay
+
+from ..auth import get_db
+from ..config import settings
+from ..settlement import reconcile, requeue_failed
+
+
+router = APIRouter(prefix="/internal/settlements", tags=["settlements"])  # operator tooling, internal HMAC only
+
+
+def _require_hmac(request: Request, payload: dict) -> None:
+    ts = request.headers.get("X-Internal-Ts") or ""
+    sign = request.headers.get("X-Internal-Sign") or ""
+    if not verify_internal_hmac_with_replay(ts, payload, sign, settings.INTERNAL_API_SECRET, redis_url=settings.REDIS_URL, ttl_secs=60):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+
+class ReconcileIn(BaseModel):
+    pass
+
+
+@router.post("/reconcile")
+def run_reconcile(payload: ReconcileIn, request: Request, db: Session = Depends(get_db)):
+    # Enqueue stopped sessions missing a settlement and report pending/failed/stale work
+    _require_hmac(request, payload.model_dump())
+    return reconcile(db)
+
+
+class RetryIn(BaseModel):
+    session_ids: list[str] | None = None  # None requeues every failed settlement
+
+
+@router.post("/retry")
+def retry_failed(payload: RetryIn, request: Request, db: Session = Depends(get_db)):
+    _require_hmac(request, payload.model_dump())
+    return {"requeued": requeue_failed(db, payload.session_ids)}
@@ -1,28 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from math import radians, cos, sin, asin, sqrt
+from superapp_shared.internal_hmac import verify_internal_hmac_with_replay
 from ..auth import get_current_user, get_db
+from ..config import settings
+from ..geo import resolve_zone, set_geometry
 from ..models import Zone, Tariff
 
 
 router = APIRouter(prefix="/zones", tags=["zones"])
 
 
-def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    # approximate radius of earth in km
-    R = 6371.0
-    d_lat = radians(lat2 - lat1)
-    d_lon = radians(lon2 - lon1)
-    a = sin(d_lat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(d_lon / 2) ** 2
-    c = 2 * asin(sqrt(a))
-    return R * c
-
-
 class ZoneNearRes(BaseModel):
     id: str
     name: str
-    distance_m: int
+    distance_m: int  # to the zone's edge; 0 when the point lies inside it
+    inside: bool = False
     tariff_per_minute_cents: int
     service_fee_bps: int
     currency: str
@@ -33,19 +28,19 @@ class ZoneNearRes(BaseModel):
 
 @router.get("/near", response_model=ZoneNearRes)
 def zone_near(lat: float, lon: float, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    zs = db.query(Zone).all()
-    if not zs:
+    # The zone the point lies in, else the nearest one (grid-indexed, see app/geo.py)
+    match = resolve_zone(db, lat, lon)
+    if match is None:
         raise HTTPException(404, "no_zones")
-    # Pick nearest center
-    nearest = min(zs, key=lambda z: _haversine_km(lat, lon, z.center_lat, z.center_lon))
-    dist_km = _haversine_km(lat, lon, nearest.center_lat, nearest.center_lon)
-    t = db.query(Tariff).filter(Tariff.zone_id == nearest.id).first()
+    zone = match.zone
+    t = db.query(Tariff).filter(Tariff.zone_id == zone.id).first()
     if not t:
         raise HTTPException(400, "tariff_missing")
     return ZoneNearRes(
-        id=str(nearest.id),
-        name=nearest.name,
-        distance_m=int(dist_km * 1000),
+        id=str(zone.id),
+        name=zone.name,
+        distance_m=int(match.distance_m),
+        inside=match.inside,
         tariff_per_minute_cents=t.per_minute_cents,
         service_fee_bps=t.service_fee_bps or 0,
         currency=t.currency or "SYP",
@@ -53,3 +48,45 @@ def zone_near(lat: float, lon: float, db: Session = Depends(get_db), user=Depend
         free_minutes=t.free_minutes,
         max_daily_cents=t.max_daily_cents,
     )
+
+
+class GeometryIn(BaseModel):
+    polygon: dict | None = None  # GeoJSON Polygon ([lon, lat] pairs); None reverts to center/radius
+    center_lat: float | None = None
+    center_lon: float | None = None
+    radius_m: int | None = None
+
+
+class GeometryOut(BaseModel):
+    id: str
+    polygon: dict | None = None
+    center_lat: float
+    center_lon: float
+    radius_m: int
+
+
+@router.put("/{zone_id}/geometry", response_model=GeometryOut)
+def put_geometry(zone_id: str, payload: GeometryIn, request: Request, db: Session = Depends(get_db)):
+    # Operator tooling only: internal HMAC, no user token
+    ts = request.headers.get("X-Internal-Ts") or ""
+    sign = request.headers.get("X-Internal-Sign") or ""
+    if not verify_internal_hmac_with_replay(ts, payload.model_dump(), sign, settings.INTERNAL_API_SECRET, redis_url=settings.REDIS_URL, ttl_secs=60):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    z = db.get(Zone, zone_id)
+    if z is None:
+        raise HTTPException(404, "zone_not_found")
+    if payload.center_lat is not None and payload.center_lon is not None:
+        z.center_lat, z.center_lon = payload.center_lat, payload.center_lon
+    if payload.radius_m is not None:
+        z.radius_m = max(1, payload.radius_m)
+    try:
+        set_geometry(db, z, json.dumps(payload.polygon) if payload.polygon else None)
+    except (ValueError, TypeError, KeyError, IndexError) as e:
+        raise HTTPException(400, f"invalid_polygon: {e}")
+    return GeometryOut(
+        id=str(z.id),
+        polygon=json.loads(z.polygon_geojson) if z.polygon_geojson else None,
+        center_lat=z.center_lat,
+        center_lon=z.center_lon,
+        radius_m=z.radius_m,
+    )
@@ -1,28 +1,411 @@
+"""Session settlement pipeline: price, apply the membership discount, pay.
+
+Stopping a session only records the stop and a ``settlements`` row, in the
+same transaction. This module works those rows off the request path:
+
+1. claim due rows (``FOR UPDATE SKIP LOCKED``), each under a lease and a
+   fencing token; every write of the attempt is conditional on that token,
+2. price once: ``pricing.compute_fee`` plus the membership discount,
+   written with the receipt; a priced session is never re-priced,
+3. transfer net to the operator and the service fee to the platform through
+   Payments ``/internal/transfer``, each leg with a fixed idempotency key
+   (``parking:<session>:net|fee``), so a retry after a timeout returns the
+   original transfer instead of paying twice; a transfer id is stored as
+   soon as it is known,
+4. mark the settlement and the session ``settled``.
+
+A failed step leaves the row pending with exponential backoff, and after
+``SETTLEMENT_MAX_ATTEMPTS`` marks it ``failed`` (``requeue_failed``). When
+the membership service stays unavailable for
+``SETTLEMENT_MEMBERSHIP_ATTEMPTS`` attempts the session is priced without
+the discount rather than held. ``reconcile`` enqueues stopped sessions that
+have no settlement row and reports stuck and failed work.
+"""
+from __future__ import annotations
+
+import logging
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
 import httpx
-from fastapi import HTTPException
+from sqlalchemy import and_, exists, func, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
 from .config import settings
+from .database import SessionLocal
+from .models import Receipt, Session as ParkSession, Settlement, Tariff, User
+from .pricing import compute_fee
+
+log = logging.getLogger("parking.settlement")
+
+
+class SettlementError(Exception):
+    """A settlement step failed; the attempt is retried later."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class LeaseLost(Exception):
+    """The settlement was reclaimed by another worker; this attempt must not write."""
+
+
+def idem_key(session_id, leg: str) -> str:
+    return f"parking:{session_id}:{leg}"
+
+
+# -- remote services ------------------------------------------------------------
+
+
+class PaymentsClient:
+    """Wallet transfers through Payments ``/internal/transfer`` (HMAC-signed, idempotent per key)."""
+
+    def __init__(self, base_url: str, secret: str, timeout: float = 10.0):
+        self.secret = secret
+        self._client = httpx.Client(base_url=base_url.rstrip("/"), timeout=timeout)
+
+    def transfer(self, from_phone: str, to_phone: str, amount_cents: int, key: str) -> str:
+        from superapp_shared.internal_hmac import sign_internal_request_headers
+
+        payload = {"from_phone": from_phone, "to_phone": to_phone, "amount_cents": int(amount_cents)}
+        headers = {**sign_internal_request_headers(payload, self.secret), "X-Idempotency-Key": key}
+        try:
+            r = self._client.post("/internal/transfer", json=payload, headers=headers)
+        except httpx.HTTPError as e:
+            raise SettlementError("payments_unreachable") from e
+        if r.status_code >= 400:
+            raise SettlementError(f"payments_http_{r.status_code}: {r.text[:120]}")
+        transfer_id = str((r.json() or {}).get("transfer_id") or "")
+        if not transfer_id:
+            raise SettlementError("payments_no_transfer_id")
+        return transfer_id[:64]
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def parking_discount(status: dict) -> Tuple[str, int]:
+    """(tier, percent): prime/basic members with a ``parking_discount[_N]`` benefit get N% (default 5)."""
+    tier = str(status.get("tier") or "none")
+    benefits = [str(b) for b in (status.get("benefits") or [])]
+    if tier not in ("prime", "basic") or not any(b.startswith("parking_discount") for b in benefits):
+        return tier, 0
+    pct = 5
+    for b in benefits:
+        if b.startswith("parking_discount_"):
+            try:
+                pct = int(b.split("_")[-1])
+            except ValueError:
+                pass
+    return tier, max(0, min(100, pct))
+
+
+class MembershipClient:
+    """Membership status from the AI gateway; 5xx and timeouts are retryable, other errors mean no membership."""
+
+    def __init__(self, base_url: str, timeout: float = 3.0):
+        self._client = httpx.Client(base_url=base_url.rstrip("/"), timeout=timeout)
+
+    def discount(self, user_id, phone: str) -> Tuple[str, int]:
+        try:
+            r = self._client.get("/v1/membership/status", params={"user_id": str(user_id), "phone": phone})
+        except httpx.HTTPError as e:
+            raise SettlementError("membership_unreachable") from e
+        if r.status_code >= 500 or r.status_code in (408, 429):
+            raise SettlementError(f"membership_http_{r.status_code}")
+        if r.status_code >= 400:
+            return "none", 0
+        return parking_discount(r.json() or {})
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def default_clients() -> Tuple[PaymentsClient, MembershipClient]:
+    return (
+        PaymentsClient(settings.PAYMENTS_BASE_URL, settings.PAYMENTS_INTERNAL_SECRET),
+        MembershipClient(settings.AI_GATEWAY_BASE_URL),
+    )
+
+
+# -- stop -------------------------------------------------------------------------
+
+
+def stop_session(db: Session, s: ParkSession, phone: str, reason: Optional[str] = None) -> Settlement:
+    """Record the stop and enqueue its settlement; nothing remote happens here."""
+    now = datetime.utcnow()
+    s.stopped_at = now
+    s.status = "stopped"
+    if reason:
+        s.auto_stopped_reason = reason
+    row = Settlement(session_id=s.id, user_id=s.user_id, phone=phone, next_attempt_at=now, created_at=now, updated_at=now)
+    db.add(row)
+    db.flush()
+    return row
+
+
+# -- stage --------------------------------------------------------------------------
+
+
+@dataclass
+class SettleReport:
+    claimed: int = 0
+    settled: int = 0
+    retried: int = 0
+    failed: int = 0
+    lease_lost: int = 0
+    reasons: Counter = field(default_factory=Counter)
+
+    def to_dict(self) -> Dict:
+        return {
+            "claimed": self.claimed, "settled": self.settled, "retried": self.retried,
+            "failed": self.failed, "lease_lost": self.lease_lost, "reasons": dict(self.reasons),
+        }
+
+
+def _claim(db: Session, now: datetime, limit: int, where=None) -> Tuple[uuid.UUID, List[uuid.UUID]]:
+    """Lease up to ``limit`` due settlements under a fresh token; expired leases are reclaimable."""
+    token = uuid.uuid4()
+    due = select(Settlement.id).where(
+        Settlement.status == "pending",
+        Settlement.next_attempt_at <= now,
+        or_(Settlement.claimed_until.is_(None), Settlement.claimed_until < now),
+    )
+    if where is not None:
+        due = due.where(where)
+    due = due.order_by(Settlement.next_attempt_at).limit(limit).with_for_update(skip_locked=True)
+    ids = db.execute(
+        update(Settlement)
+        .where(Settlement.id.in_(due.scalar_subquery()))
+        .values(
+            claimed_until=now + timedelta(seconds=settings.SETTLEMENT_LEASE_SECS),
+            claim_token=token, attempts=Settlement.attempts + 1, updated_at=now,
+        )
+        .returning(Settlement.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    db.commit()
+    return token, list(ids)
+
+
+def _fenced(db: Session, sid: uuid.UUID, token: uuid.UUID, **values) -> None:
+    n = db.execute(
+        update(Settlement)
+        .where(Settlement.id == sid, Settlement.claim_token == token)
+        .values(updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if n != 1:
+        raise LeaseLost(str(sid))
+
+
+def _price(db: Session, st: Settlement, s: ParkSession, token: uuid.UUID, membership) -> None:
+    t = db.query(Tariff).filter(Tariff.zone_id == s.zone_id).first()
+    if t is None:
+        raise SettlementError("tariff_missing")
+    minutes, gross, fee, net = compute_fee(s.started_at, s.stopped_at, t)
+    try:
+        tier, pct = membership.discount(st.user_id, st.phone)
+    except SettlementError:
+        if st.attempts < settings.SETTLEMENT_MEMBERSHIP_ATTEMPTS:
+            raise
+        # Do not hold the payment on the discount any longer
+        log.warning("membership unavailable for session %s after %d attempts; pricing without discount", s.id, st.attempts)
+        tier, pct = "unavailable", 0
+    discount = int(round(net * (pct / 100.0)))
+    net = max(0, net - discount)
+    _fenced(db, st.id, token, priced_at=datetime.utcnow(), membership_tier=tier[:32], discount_pct=pct, discount_cents=discount)
+    s.minutes_billed, s.gross_cents, s.fee_cents, s.net_cents = minutes, gross, fee, net
+    if db.query(Receipt).filter(Receipt.session_id == s.id).one_or_none() is None:
+        db.add(Receipt(session_id=s.id, minutes=minutes, gross_cents=gross, fee_cents=fee, net_cents=net, currency=t.currency or "SYP"))
+    db.commit()
+
+
+def _leg(db: Session, st: Settlement, token: uuid.UUID, payments, leg: str, to_phone: str, amount: Optional[int]) -> None:
+    column = f"{leg}_transfer_id"
+    if not amount or amount <= 0 or getattr(st, column):
+        return
+    transfer_id = payments.transfer(st.phone, to_phone, int(amount), idem_key(st.session_id, leg))
+    _fenced(db, st.id, token, **{column: transfer_id})
+    db.commit()
+
+
+def _fail(db: Session, sid: uuid.UUID, token: uuid.UUID, reason: str) -> str:
+    db.rollback()
+    attempts = db.execute(select(Settlement.attempts).where(Settlement.id == sid)).scalar() or 0
+    final = attempts >= settings.SETTLEMENT_MAX_ATTEMPTS
+    delay = min(3600, settings.SETTLEMENT_RETRY_BASE_SECS * 2 ** max(0, attempts - 1))
+    try:
+        _fenced(
+            db, sid, token, status="failed" if final else "pending", claimed_until=None, last_error=reason[:255],
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+        )
+    except LeaseLost:
+        db.rollback()
+        return "lease_lost"
+    db.commit()
+    return "failed" if final else "retried"
+
+
+def _settle_one(sid: uuid.UUID, token: uuid.UUID, payments, membership, session_factory) -> Tuple[str, Optional[str]]:
+    db = session_factory()
+    try:
+        st = db.get(Settlement, sid)
+        if st is None or st.claim_token != token or st.status != "pending":
+            return "lease_lost", None
+        try:
+            s = db.get(ParkSession, st.session_id)
+            if st.priced_at is None:
+                _price(db, st, s, token, membership)
+            _leg(db, st, token, payments, "net", settings.OPERATOR_PHONE, s.net_cents)
+            _leg(db, st, token, payments, "fee", settings.FEE_WALLET_PHONE, s.fee_cents)
+            _fenced(db, sid, token, status="settled", settled_at=datetime.utcnow(), claimed_until=None, last_error=None)
+            s.status = "settled"
+            db.commit()
+            return "settled", None
+        except LeaseLost:
+            db.rollback()
+            return "lease_lost", None
+        except SettlementError as e:
+            return _fail(db, sid, token, e.reason), e.reason.split(":")[0]
+        except Exception as e:
+            log.exception("settlement %s raised", sid)
+            return _fail(db, sid, token, f"error: {type(e).__name__}"), "error"
+    finally:
+        db.close()
+
+
+def settle_due(
+    *,
+    where=None,
+    payments=None,
+    membership=None,
+    batch: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    max_batches: Optional[int] = None,
+    check: Optional[Callable[[], None]] = None,
+    session_factory=SessionLocal,
+    now: Optional[datetime] = None,
+) -> SettleReport:
+    """Claim and process due settlements, a batch at a time, until none are due."""
+    batch = batch or settings.SETTLEMENT_BATCH
+    concurrency = max(1, concurrency or settings.SETTLEMENT_CONCURRENCY)
+    own = payments is None or membership is None
+    if own:
+        dp, dm = default_clients()
+        payments, membership = payments or dp, membership or dm
+    report = SettleReport()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="parking-settle") if concurrency > 1 else None
+    try:
+        n = 0
+        while max_batches is None or n < max_batches:
+            n += 1
+            if check is not None:
+                check()
+            db = session_factory()
+            try:
+                token, ids = _claim(db, now or datetime.utcnow(), batch, where)
+            finally:
+                db.close()
+            if not ids:
+                break
+            report.claimed += len(ids)
+
+            def one(sid: uuid.UUID) -> Tuple[str, Optional[str]]:
+                return _settle_one(sid, token, payments, membership, session_factory)
+
+            outcomes = list(pool.map(one, ids)) if pool is not None and len(ids) > 1 else [one(i) for i in ids]
+            for outcome, reason in outcomes:
+                setattr(report, outcome, getattr(report, outcome) + 1)
+                if reason:
+                    report.reasons[reason] += 1
+            if len(ids) < batch:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        if own:
+            for c in (payments, membership):
+                close = getattr(c, "close", None)
+                if close is not None:
+                    close()
+    if report.failed:
+        log.warning("parking settlement: %d settlement(s) failed permanently", report.failed)
+    return report
+
+
+def kick(settlement_id: uuid.UUID) -> None:
+    """Best-effort immediate attempt right after a stop; the scheduled job is the durable path."""
+    try:
+        settle_due(where=Settlement.id == settlement_id, concurrency=1, max_batches=1)
+    except Exception:
+        log.exception("immediate settlement of %s failed; left for the scheduled run", settlement_id)
+
+
+# -- reconciliation ------------------------------------------------------------------
+
 
+def reconcile(db: Session, now: Optional[datetime] = None) -> Dict:
+    """Enqueue stopped sessions without a settlement row and report work that needs attention."""
+    now = now or datetime.utcnow()
+    orphans = (
+        select(
+            func.gen_random_uuid(), ParkSession.id, ParkSession.user_id, func.coalesce(User.phone, "unknown"),
+            literal("pending"), literal(0), literal(now), literal(now), literal(now),
+        )
+        .select_from(ParkSession)
+        .outerjoin(User, User.id == ParkSession.user_id)
+        .where(ParkSession.status == "stopped", ~exists().where(Settlement.session_id == ParkSession.id))
+    )
+    enqueued = db.execute(
+        pg_insert(Settlement.__table__)
+        .from_select(["id", "session_id", "user_id", "phone", "status", "attempts", "next_attempt_at", "created_at", "updated_at"], orphans)
+        .on_conflict_do_nothing(index_elements=["session_id"])
+        .returning(Settlement.__table__.c.id)
+    ).scalars().all()
+    counts = dict(db.execute(select(Settlement.status, func.count()).group_by(Settlement.status)).all())
+    stale = db.execute(
+        select(func.count()).select_from(Settlement).where(Settlement.status == "pending", Settlement.claimed_until < now)
+    ).scalar() or 0
+    overdue = db.execute(
+        select(func.count()).select_from(Settlement).where(
+            Settlement.status == "pending", Settlement.next_attempt_at < now - timedelta(seconds=settings.SETTLEMENT_OVERDUE_SECS),
+        )
+    ).scalar() or 0
+    # Settled rows must carry a transfer for every leg that had an amount
+    unpaid = db.execute(
+        select(func.count()).select_from(Settlement).join(ParkSession, ParkSession.id == Settlement.session_id).where(
+            Settlement.status == "settled",
+            or_(
+                and_(ParkSession.net_cents > 0, Settlement.net_transfer_id.is_(None)),
+                and_(ParkSession.fee_cents > 0, Settlement.fee_transfer_id.is_(None)),
+            ),
+        )
+    ).scalar() or 0
+    db.commit()
+    out = {
+        "enqueued": len(enqueued), "pending": counts.get("pending", 0), "settled": counts.get("settled", 0),
+        "failed": counts.get("failed", 0), "stale_claims": stale, "overdue": overdue, "settled_without_transfer": unpaid,
+    }
+    if out["failed"] or out["overdue"] or unpaid:
+        log.warning("parking settlement reconciliation: %s", out)
+    return out
 
-async def settle_with_payments(*, from_phone: str, operator_phone: str, fee_phone: str, net_cents: int, fee_cents: int) -> None:
-    base = settings.PAYMENTS_BASE_URL.rstrip('/')
-    headers = {"X-Internal-Secret": settings.PAYMENTS_INTERNAL_SECRET}
-    async with httpx.AsyncClient(timeout=10) as cli:
-        # Transfer net to operator
-        if net_cents and net_cents > 0:
-            r = await cli.post(
-                f"{base}/internal/transfer",
-                headers=headers,
-                json={"from_phone": from_phone, "to_phone": operator_phone, "amount_cents": int(net_cents)},
-            )
-            if r.status_code >= 400:
-                raise HTTPException(status_code=500, detail=f"settlement_net_failed: {r.text}")
-        # Transfer fee to platform
-        if fee_cents and fee_cents > 0:
-            r = await cli.post(
-                f"{base}/internal/transfer",
-                headers=headers,
-                json={"from_phone": from_phone, "to_phone": fee_phone, "amount_cents": int(fee_cents)},
-            )
-            if r.status_code >= 400:
-                raise HTTPException(status_code=500, detail=f"settlement_fee_failed: {r.text}")
 
+def requeue_failed(db: Session, session_ids: Optional[Iterable] = None) -> int:
+    """Put failed settlements back in the queue with a fresh attempt budget."""
+    q = update(Settlement).where(Settlement.status == "failed")
+    if session_ids is not None:
+        q = q.where(Settlement.session_id.in_(list(session_ids)))
+    n = db.execute(
+        q.values(status="pending", attempts=0, next_attempt_at=datetime.utcnow(), claimed_until=None, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return n
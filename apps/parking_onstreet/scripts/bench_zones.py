@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark the grid-indexed zone lookup (app.geo.resolve_zone).
+
+Usage:
+  DB_URL=postgresql+psycopg2://... python apps/parking_onstreet/scripts/bench_zones.py \
+      [--zones 100000] [--lookups 2000] [--legacy-sample 5]
+
+Seeds ``--zones`` street-block polygons (~90 x 90 m, 110 m apart) on a
+square grid at a random spot, indexes their cells, then resolves random
+points: half inside a known block (checked against the expected zone), half
+in the gaps between blocks. Reports lookups/s and rows loaded per lookup,
+and times ``--legacy-sample`` lookups the way ``/zones/near`` used to do them
+(load every zone, nearest center by haversine) for comparison. Seeded rows
+are left in place; use a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event, insert, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs", "superapp_shared"))
+
+if not os.getenv("DB_URL"):
+    print("Set DB_URL env to point to a scratch parking_onstreet database", file=sys.stderr)
+    sys.exit(2)
+
+from superapp_shared.geo import haversine_m  # noqa: E402
+
+from app.database import SessionLocal, engine  # type: ignore  # noqa: E402
+from app.geo import resolve_zone, zone_bbox, zone_cells  # type: ignore  # noqa: E402
+from app.models import Base, Zone, ZoneCell  # type: ignore  # noqa: E402
+
+STEP = 0.001
+SIZE = 0.0008
+
+
+def _block(lat0: float, lon0: float, i: int, j: int) -> list:
+    lat, lon = lat0 + i * STEP, lon0 + j * STEP
+    return [[lon, lat], [lon + SIZE, lat], [lon + SIZE, lat + SIZE], [lon, lat + SIZE], [lon, lat]]
+
+
+def _seed(lat0: float, lon0: float, side: int, count: int) -> dict:
+    now = datetime.utcnow()
+    ids = {}
+    with engine.begin() as conn:
+        for start in range(0, count, 5000):
+            zones, cells = [], []
+            for k in range(start, min(count, start + 5000)):
+                i, j = divmod(k, side)
+                zid = uuid.uuid4()
+                ids[(i, j)] = zid
+                z = Zone(
+                    id=zid, name=f"bench-{i}-{j}", tz_code="Asia/Damascus", radius_m=60,
+                    center_lat=lat0 + i * STEP + SIZE / 2, center_lon=lon0 + j * STEP + SIZE / 2,
+                    polygon_geojson=json.dumps({"type": "Polygon", "coordinates": [_block(lat0, lon0, i, j)]}),
+                    geometry_updated_at=now,
+                )
+                z.bbox_min_lat, z.bbox_min_lon, z.bbox_max_lat, z.bbox_max_lon = zone_bbox(z)
+                zones.append({c.name: getattr(z, c.key) for c in Zone.__table__.columns})
+                cells.extend({"cell": c, "zone_id": zid} for c in zone_cells(z))
+            conn.execute(insert(Zone.__table__), zones)
+            conn.execute(insert(ZoneCell.__table__), cells)
+    return ids
+
+
+def _legacy(db, lat: float, lon: float):
+    zs = db.query(Zone).all()
+    return min(zs, key=lambda z: haversine_m(lat, lon, z.center_lat, z.center_lon))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--zones", type=int, default=100_000)
+    ap.add_argument("--lookups", type=int, default=2000)
+    ap.add_argument("--legacy-sample", type=int, default=5)
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random()
+    side = math.ceil(math.sqrt(args.zones))
+    lat0, lon0 = rnd.uniform(-60, 60 - side * STEP), rnd.uniform(-170, 170 - side * STEP)
+    t0 = time.perf_counter()
+    ids = _seed(lat0, lon0, side, args.zones)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE zones"))
+        conn.execute(text("ANALYZE zone_cells"))
+    print(f"seeded {args.zones:,} polygon zones in {time.perf_counter() - t0:.1f}s")
+
+    keys = list(ids)
+    points = []
+    for n in range(args.lookups):
+        i, j = rnd.choice(keys)
+        if n % 2 == 0:
+            points.append((lat0 + i * STEP + rnd.uniform(0, SIZE), lon0 + j * STEP + rnd.uniform(0, SIZE), ids[(i, j)]))
+        else:
+            points.append((lat0 + i * STEP + SIZE + rnd.uniform(0, STEP - SIZE) * 0.9, lon0 + j * STEP + rnd.uniform(0, SIZE), None))
+
+    loaded = [0]
+
+    def _count(conn, cursor, statement, params, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM zones" in statement:
+            loaded[0] += 1
+
+    event.listen(engine, "before_cursor_execute", _count)
+    db = SessionLocal()
+    try:
+        inside = outside = 0
+        t0 = time.perf_counter()
+        for lat, lon, expected in points:
+            m = resolve_zone(db, lat, lon)
+            if expected is not None:
+                assert m is not None and m.inside and m.zone.id == expected, (lat, lon)
+                inside += 1
+            else:
+                assert m is not None and not m.inside and m.distance_m < STEP * 111_320, (lat, lon)
+                outside += 1
+            db.expunge_all()
+        secs = time.perf_counter() - t0
+        queries = loaded[0]
+        print(
+            f"indexed : {len(points):,} lookups in {secs:.2f}s ({len(points) / max(secs, 1e-9):,.0f}/s, "
+            f"{secs / len(points) * 1000:.2f} ms each), {inside} inside / {outside} between blocks, "
+            f"{queries / len(points):.2f} zone queries per lookup"
+        )
+
+        if args.legacy_sample:
+            total = db.execute(text("SELECT count(*) FROM zones")).scalar()
+            t0 = time.perf_counter()
+            for lat, lon, _ in points[: args.legacy_sample]:
+                _legacy(db, lat, lon)
+                db.expunge_all()
+            secs = time.perf_counter() - t0
+            n = min(args.legacy_sample, len(points))
+            print(f"legacy  : {n} lookups in {secs:.2f}s ({secs / n * 1000:.0f} ms each, {total:,} zones loaded per lookup)")
+    finally:
+        db.close()
+        event.remove(engine, "before_cursor_execute", _count)
+
+
+if __name__ == "__main__":
+    main()
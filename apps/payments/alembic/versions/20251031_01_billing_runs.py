@@ -0,0 +1,44 @@
+"""add billing_runs and invoice status/due index
+
+Revision ID: 20251031_01
+Revises: 20251030_02_username_password
+Create Date: 2025-10-31
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '20251031_01'
+down_revision = '20251030_02_username_password'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'billing_runs',
+        sa.Column('id', sa.dialects.postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('kind', sa.String(length=32), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('scanned_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('paid_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('paid_cents', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('skipped_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failed_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failed_cents', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('chunks', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('reasons', sa.JSON(), nullable=True),
+        sa.Column('failures', sa.JSON(), nullable=True),
+        sa.Column('error', sa.String(length=512), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_billing_runs_kind_started', 'billing_runs', ['kind', 'started_at'])
+    op.create_index('ix_invoice_status_due', 'invoices', ['status', 'due_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_invoice_status_due', table_name='invoices')
+    op.drop_index('ix_billing_runs_kind_started', table_name='billing_runs')
+    op.drop_table('billing_runs')
@@ -0,0 +1,64 @@
+"""add ledger_campaigns and ledger_campaign_recipients
+
+Revision ID: 20251101_01
+Revises: 20251031_01
+Create Date: 2025-11-01
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '20251101_01'
+down_revision = '20251031_01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ledger_campaigns',
+        sa.Column('id', sa.dialects.postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('name', sa.String(length=128), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('amount_cents', sa.Integer(), nullable=True),
+        sa.Column('currency_code', sa.String(length=8), nullable=False, server_default='SYP'),
+        sa.Column('memo', sa.String(length=255), nullable=True),
+        sa.Column('recipient_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('processed_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('applied_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('applied_cents', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('skipped_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failed_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('chunks', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('reasons', sa.JSON(), nullable=True),
+        sa.Column('error', sa.String(length=512), nullable=True),
+        sa.Column('worker_id', sa.String(length=64), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_ledger_campaigns_status', 'ledger_campaigns', ['status', 'heartbeat_at'])
+    op.create_table(
+        'ledger_campaign_recipients',
+        sa.Column('id', sa.dialects.postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('campaign_id', sa.dialects.postgresql.UUID(as_uuid=True), sa.ForeignKey('ledger_campaigns.id'), nullable=False),
+        sa.Column('user_id', sa.dialects.postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('amount_cents', sa.Integer(), nullable=False),
+        sa.Column('idempotency_key', sa.String(length=64), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False, server_default='pending'),
+        sa.Column('reason', sa.String(length=64), nullable=True),
+        sa.Column('transfer_id', sa.dialects.postgresql.UUID(as_uuid=True), sa.ForeignKey('transfers.id'), nullable=True),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.UniqueConstraint('campaign_id', 'user_id', name='uq_campaign_recipient_user'),
+    )
+    op.create_index('ix_campaign_recipient_status', 'ledger_campaign_recipients', ['campaign_id', 'status', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_campaign_recipient_status', table_name='ledger_campaign_recipients')
+    op.drop_table('ledger_campaign_recipients')
+    op.drop_index('ix_ledger_campaigns_status', table_name='ledger_campaigns')
+    op.drop_table('ledger_campaigns')
@@ -0,0 +1,54 @@
+"""add risk_rule_sets and risk_decisions
+
+Revision ID: 20251102_01
+Revises: 20251101_01
+Create Date: 2025-11-02
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '20251102_01'
+down_revision = '20251101_01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'risk_rule_sets',
+        sa.Column('id', sa.dialects.postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('name', sa.String(length=128), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('version', sa.String(length=64), nullable=False),
+        sa.Column('body', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('retired_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_risk_rule_sets_status', 'risk_rule_sets', ['status', 'created_at'])
+    op.create_table(
+        'risk_decisions',
+        sa.Column('id', sa.dialects.postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('context', sa.String(length=32), nullable=False),
+        sa.Column('user_id', sa.dialects.postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('amount_cents', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('action', sa.String(length=8), nullable=False),
+        sa.Column('score', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('enforced', sa.Boolean(), nullable=False, server_default=sa.text('true')),
+        sa.Column('version', sa.String(length=64), nullable=False),
+        sa.Column('hits', sa.JSON(), nullable=True),
+        sa.Column('features', sa.JSON(), nullable=True),
+        sa.Column('shadow', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_risk_decisions_user_created', 'risk_decisions', ['user_id', 'created_at'])
+    op.create_index('ix_risk_decisions_action_created', 'risk_decisions', ['action', 'created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_risk_decisions_action_created', table_name='risk_decisions')
+    op.drop_index('ix_risk_decisions_user_created', table_name='risk_decisions')
+    op.drop_table('risk_decisions')
+    op.drop_index('ix_risk_rule_sets_status', table_name='risk_rule_sets')
+    op.drop_table('risk_rule_sets')
@@ -0,0 +1,40 @@
+"""voucher batches and incremental voucher_stats
+
+Revision ID: 20251103_01
+Revises: 20251102_01
+Create Date: 2025-11-03
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '20251103_01'
+down_revision = '20251102_01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('topup_vouchers', sa.Column('batch_id', sa.dialects.postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_index('ix_voucher_batch', 'topup_vouchers', ['batch_id'])
+    op.create_table(
+        'voucher_stats',
+        sa.Column('created_by_user_id', sa.dialects.postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('status', sa.String(length=16), primary_key=True),
+        sa.Column('shard', sa.Integer(), primary_key=True),
+        sa.Column('count', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('amount_cents', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+    # Backfill from existing vouchers; from here on the app keeps the counters current
+    op.execute(
+        "INSERT INTO voucher_stats (created_by_user_id, status, shard, count, amount_cents) "
+        "SELECT created_by_user_id, status, 0, count(*), coalesce(sum(amount_cents), 0) "
+        "FROM topup_vouchers GROUP BY created_by_user_id, status"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('voucher_stats')
+    op.drop_index('ix_voucher_batch', table_name='topup_vouchers')
+    op.drop_column('topup_vouchers', 'batch_id')
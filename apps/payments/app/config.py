@@ -50,11 +50,19 @@ class Settings:
     # Internal API signing
     INTERNAL_REQUIRE_HMAC: bool = env_bool("INTERNAL_REQUIRE_HMAC", default=True)
     INTERNAL_HMAC_TTL_SECS: int = int(os.getenv("INTERNAL_HMAC_TTL_SECS", "300"))
+    # Idempotency-Key retention (stored responses and idempotency_keys rows)
+    IDEMPOTENCY_TTL_SECS: int = int(os.getenv("IDEMPOTENCY_TTL_SECS", "86400"))
     # KYC policy (cents)
     KYC_L0_TX_MAX_CENTS: int = int(os.getenv("KYC_L0_TX_MAX_CENTS", "100000000"))  # 1,000,000.00 SYP
     KYC_L0_DAILY_MAX_CENTS: int = int(os.getenv("KYC_L0_DAILY_MAX_CENTS", "500000000"))
     KYC_L1_TX_MAX_CENTS: int = int(os.getenv("KYC_L1_TX_MAX_CENTS", "500000000"))
     KYC_L1_DAILY_MAX_CENTS: int = int(os.getenv("KYC_L1_DAILY_MAX_CENTS", "2000000000"))
+    # Invoice autopay billing run: invoices per run and per chunk transaction
+    INVOICE_AUTOPAY_MAX_PER_RUN: int = int(os.getenv("INVOICE_AUTOPAY_MAX_PER_RUN", "100000"))
+    INVOICE_AUTOPAY_CHUNK_SIZE: int = int(os.getenv("INVOICE_AUTOPAY_CHUNK_SIZE", "500"))
+    # Bulk ledger campaigns: recipients per chunk transaction, heartbeat age after which a run is taken over
+    LEDGER_CAMPAIGN_CHUNK_SIZE: int = int(os.getenv("LEDGER_CAMPAIGN_CHUNK_SIZE", "1000"))
+    LEDGER_CAMPAIGN_STALE_SECS: int = int(os.getenv("LEDGER_CAMPAIGN_STALE_SECS", "120"))
     KYC_MIN_LEVEL_FOR_MERCHANT_PAY: int = int(os.getenv("KYC_MIN_LEVEL_FOR_MERCHANT_PAY", "1"))
     KYC_MIN_LEVEL_FOR_MERCHANT_QR: int = int(os.getenv("KYC_MIN_LEVEL_FOR_MERCHANT_QR", "1"))
     # Fees
@@ -64,6 +72,10 @@ class Settings:
     CASHOUT_FEE_BPS: int = int(os.getenv("CASHOUT_FEE_BPS", "0"))
     # Voucher cash top-up fee (in basis points)
     VOUCHER_FEE_BPS: int = int(os.getenv("VOUCHER_FEE_BPS", "100"))  # default 1%
+    # Largest admin voucher batch per request (POST /vouchers/admin/batches)
+    VOUCHER_BATCH_MAX_COUNT: int = int(os.getenv("VOUCHER_BATCH_MAX_COUNT", "1000000"))
+    # Counter rows per (creator, status) in voucher_stats; more shards = less redemption contention
+    VOUCHER_STATS_SHARDS: int = int(os.getenv("VOUCHER_STATS_SHARDS", "8"))
     INTERNAL_API_SECRET: str = os.getenv("INTERNAL_API_SECRET", "dev_secret")
     ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
     ADMIN_TOKEN_SHA256: str = os.getenv("ADMIN_TOKEN_SHA256", "")
@@ -1,5 +1,4 @@
 import os
-import asyncio
 from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
@@ -39,6 +38,11 @@ from .middleware_rate_limit import SlidingWindowLimiter
 from .middleware_rate_limit_redis import RedisRateLimiter
 from .middleware_request_id import RequestIDMiddleware
 from .utils.security_headers import SecurityHeadersMiddleware
+from .utils.idempotency_store import request_credential, response_store
+from superapp_shared.idempotency import IdempotencyMiddleware, register_prometheus_collector as register_idempotency_metrics
+from superapp_shared.redis_pool import install_redis_lifecycle
+from superapp_shared.risk import RiskContextMiddleware, register_prometheus_collector as register_risk_metrics
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, sql_partition_clause, store_from_env
 
 # Optional OpenTelemetry tracing (enabled via env OTEL_EXPORTER_OTLP_ENDPOINT)
 def _init_tracing(app: FastAPI) -> None:
@@ -68,6 +72,76 @@ def _init_tracing(app: FastAPI) -> None:
         pass
 
 
+def _env_secs(name: str) -> int:
+    try:
+        return int(os.getenv(name, "0"))
+    except Exception:
+        return 0
+
+
+_JOB_INTERVAL_ENVS = {
+    "invoice_autopay": "INVOICES_AUTOPAY_POLL_SECS",
+    "subscriptions_due": "SUBSCRIPTIONS_POLL_SECS",
+    "webhook_deliveries": "WEBHOOK_WORKER_POLL_SECS",
+    "ledger_campaigns": "LEDGER_CAMPAIGNS_POLL_SECS",
+    "idempotency_gc": "IDEMPOTENCY_GC_POLL_SECS",
+}
+
+
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler with the payments background jobs; intervals of 0 leave a job disabled."""
+    from .models import Invoice, LedgerCampaign, Subscription, WebhookDelivery
+    from .utils.campaigns import run_queued_campaigns
+    from .utils.idempotency_store import gc_expired
+
+    sched = Scheduler(store or store_from_env(engine, os.getenv("REDIS_URL")), service="payments", **kw)
+    partitions = max(1, _env_secs("SCHEDULER_PARTITIONS") or 4)
+
+    def _invoice_autopay(ctx):
+        # Partition by payer so a payer wallet is only ever charged from one partition
+        return invoices_router.process_all_due_once(where=sql_partition_clause(Invoice.payer_user_id, ctx))
+
+    def _subscriptions(ctx):
+        db = SessionLocal()
+        try:
+            out = subscriptions_router.process_due_once(db, max_count=200, where=sql_partition_clause(Subscription.id, ctx))
+            ctx.check()
+            db.commit()
+            return out
+        finally:
+            db.close()
+
+    def _webhook_deliveries(ctx):
+        db = SessionLocal()
+        try:
+            webhooks_router._process_once(db, limit=50, where=sql_partition_clause(WebhookDelivery.id, ctx))  # type: ignore[attr-defined]
+            db.commit()
+        finally:
+            db.close()
+
+    def _ledger_campaigns(ctx):
+        # Picks up queued campaigns and resumes ones whose worker died mid-run
+        return {"runs": len(run_queued_campaigns(where=sql_partition_clause(LedgerCampaign.id, ctx)))}
+
+    def _idempotency_gc(ctx):
+        return gc_expired()
+
+    jobs = {
+        "invoice_autopay": _invoice_autopay,
+        "subscriptions_due": _subscriptions,
+        "webhook_deliveries": _webhook_deliveries,
+        "ledger_campaigns": _ledger_campaigns,
+        "idempotency_gc": _idempotency_gc,
+    }
+    for name, env in _JOB_INTERVAL_ENVS.items():
+        secs = _env_secs(env)
+        func = jobs[name]
+        # GC deletes by expiry, not by a partitionable key
+        parts = 1 if name == "idempotency_gc" else partitions
+        sched.add_job(name, func, IntervalTrigger(max(secs, 1)), partitions=parts, lease_secs=max(30, secs * 3), enabled=secs > 0)
+    return sched
+
+
 def create_app() -> FastAPI:
     app = FastAPI(title="Payments API", version="0.1.0", docs_url="/docs")
 
@@ -93,6 +167,18 @@ def create_app() -> FastAPI:
             pass
     # Secure default HTTP headers
     app.add_middleware(SecurityHeadersMiddleware)
+    # Device key (X-Device-ID or IP/UA fingerprint) for the risk engine's per-device features
+    app.add_middleware(RiskContextMiddleware)
+    # Idempotency-Key (header or body idempotency_key): replay stored responses, coalesce concurrent duplicates
+    app.add_middleware(
+        IdempotencyMiddleware,
+        store=response_store(),
+        service="payments",
+        exclude_paths=["/auth", "/admin"],
+        body_field="idempotency_key",
+        credential=request_credential,
+        ttl_secs=settings.IDEMPOTENCY_TTL_SECS,
+    )
 
     # Rate limiting
     backend = (getattr(settings, "RATE_LIMIT_BACKEND", "") or "").lower()
@@ -162,10 +248,17 @@ def create_app() -> FastAPI:
             pass
         return response
 
+    # risk_* decision / shadow disagreement / reload metrics
+    register_risk_metrics()
+    register_idempotency_metrics()
+
     @app.get("/metrics")
     def metrics():
         return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
+    # Shared Redis pools: warm on startup, close on shutdown, export pool gauges
+    install_redis_lifecycle(app, settings.REDIS_URL)
+
     # Initialize tracing late to ensure app exists
     _init_tracing(app)
 
@@ -197,43 +290,10 @@ def create_app() -> FastAPI:
     app.add_exception_handler(AppError, app_error_handler)
     app.add_exception_handler(HTTPException, http_exception_handler)
 
-    # Optional background scheduler for invoice autopay sweep
-    try:
-        poll = int(os.getenv("INVOICES_AUTOPAY_POLL_SECS", "0"))
-    except Exception:
-        poll = 0
-    if poll > 0:
-        @app.on_event("startup")
-        async def _start_invoice_autopay_scheduler():
-            async def _loop():
-                while True:
-                    try:
-                        invoices_router.process_all_due_once()
-                    except Exception:
-                        pass
-                    await asyncio.sleep(poll)
-            asyncio.create_task(_loop())
-
-    # Background worker for webhook deliveries (dev opt-in)
-    try:
-        wh_poll = int(os.getenv("WEBHOOK_WORKER_POLL_SECS", "0"))
-    except Exception:
-        wh_poll = 0
-    if wh_poll > 0:
-        @app.on_event("startup")
-        async def _start_webhook_worker():
-            async def _loop():
-                while True:
-                    try:
-                        db = SessionLocal()
-                        try:
-                            webhooks_router._process_once(db, limit=50)  # type: ignore[attr-defined]
-                        finally:
-                            db.close()
-                    except Exception:
-                        pass
-                    await asyncio.sleep(wh_poll)
-            asyncio.create_task(_loop())
+    # Background jobs (invoice autopay, subscriptions, webhook deliveries) run under
+    # leases from the shared scheduler so each due item is handled by one replica.
+    if any(_env_secs(env) > 0 for env in _JOB_INTERVAL_ENVS.values()):
+        install_scheduler(app, build_scheduler())
 
     return app
 
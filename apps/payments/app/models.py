@@ -4,6 +4,7 @@ from sqlalchemy import (
     Column,
     String,
     Integer,
+    BigInteger,
     DateTime,
     Boolean,
     ForeignKey,
@@ -284,6 +285,7 @@ class TopupVoucher(Base):
     __table_args__ = (
         UniqueConstraint("code", name="uq_voucher_code"),
         Index("ix_voucher_status_created", "status", "created_at"),
+        Index("ix_voucher_batch", "batch_id"),
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
@@ -295,11 +297,28 @@ class TopupVoucher(Base):
     redeemed_by_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     redeemed_at = Column(DateTime, nullable=True)
+    batch_id = Column(UUID(as_uuid=True), nullable=True)  # issuance batch (utils/vouchers.issue_vouchers)
 
     created_by = relationship("User", foreign_keys=[created_by_user_id])
     redeemed_by = relationship("User", foreign_keys=[redeemed_by_user_id])
 
 
+class VoucherStat(Base):
+    """Voucher count/amount per creator and status, kept current by utils/vouchers.
+
+    Each (creator, status) is spread over a few ``shard`` rows so concurrent
+    redemptions do not queue on one counter row; readers sum the shards.
+    """
+
+    __tablename__ = "voucher_stats"
+
+    created_by_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    status = Column(String(16), primary_key=True)
+    shard = Column(Integer, primary_key=True, default=0)
+    count = Column(BigInteger, nullable=False, default=0)
+    amount_cents = Column(BigInteger, nullable=False, default=0)
+
+
 class EBillMandate(Base):
     __tablename__ = "ebill_mandates"
     __table_args__ = (
@@ -325,6 +344,7 @@ class Invoice(Base):
     __table_args__ = (
         Index("ix_invoice_payer_status", "payer_user_id", "status"),
         Index("ix_invoice_due_at", "due_at"),
+        Index("ix_invoice_status_due", "status", "due_at"),
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
@@ -377,3 +397,103 @@ class IdempotencyKey(Base):
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     user = relationship("User")
+
+
+class BillingRun(Base):
+    __tablename__ = "billing_runs"
+    __table_args__ = (Index("ix_billing_runs_kind_started", "kind", "started_at"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    kind = Column(String(32), nullable=False)  # invoice_autopay
+    status = Column(String(16), nullable=False, default="running")  # running|completed|failed
+    scanned_count = Column(Integer, nullable=False, default=0)
+    paid_count = Column(Integer, nullable=False, default=0)
+    paid_cents = Column(BigInteger, nullable=False, default=0)
+    skipped_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    failed_cents = Column(BigInteger, nullable=False, default=0)
+    chunks = Column(Integer, nullable=False, default=0)
+    reasons = Column(JSON, nullable=True)  # {reason: count} for skipped/failed items
+    failures = Column(JSON, nullable=True)  # sample [{invoice_id, reason}]
+    error = Column(String(512), nullable=True)
+    started_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class LedgerCampaign(Base):
+    __tablename__ = "ledger_campaigns"
+    __table_args__ = (Index("ix_ledger_campaigns_status", "status", "heartbeat_at"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    name = Column(String(128), nullable=False)
+    kind = Column(String(16), nullable=False)  # credit|debit|fee_adjustment
+    status = Column(String(16), nullable=False, default="draft")  # draft|queued|running|paused|completed|failed|cancelled
+    amount_cents = Column(Integer, nullable=True)  # default per-recipient amount
+    currency_code = Column(String(8), nullable=False, default="SYP")
+    memo = Column(String(255), nullable=True)
+    recipient_count = Column(Integer, nullable=False, default=0)
+    processed_count = Column(Integer, nullable=False, default=0)
+    applied_count = Column(Integer, nullable=False, default=0)
+    applied_cents = Column(BigInteger, nullable=False, default=0)  # signed, from the recipients' point of view
+    skipped_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    chunks = Column(Integer, nullable=False, default=0)
+    reasons = Column(JSON, nullable=True)  # {reason: count} for skipped/failed recipients
+    error = Column(String(512), nullable=True)
+    worker_id = Column(String(64), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class LedgerCampaignRecipient(Base):
+    __tablename__ = "ledger_campaign_recipients"
+    __table_args__ = (
+        UniqueConstraint("campaign_id", "user_id", name="uq_campaign_recipient_user"),
+        Index("ix_campaign_recipient_status", "campaign_id", "status", "id"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    campaign_id = Column(UUID(as_uuid=True), ForeignKey("ledger_campaigns.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    amount_cents = Column(Integer, nullable=False)  # signed for fee adjustments (+ refund, - charge)
+    idempotency_key = Column(String(64), nullable=True)  # defaults to camp-<recipient id>
+    status = Column(String(16), nullable=False, default="pending")  # pending|applied|skipped|failed
+    reason = Column(String(64), nullable=True)
+    transfer_id = Column(UUID(as_uuid=True), ForeignKey("transfers.id"), nullable=True)
+    processed_at = Column(DateTime, nullable=True)
+
+
+class RiskRuleSet(Base):
+    __tablename__ = "risk_rule_sets"
+    __table_args__ = (Index("ix_risk_rule_sets_status", "status", "created_at"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    name = Column(String(128), nullable=False)
+    status = Column(String(16), nullable=False, default="shadow")  # active|shadow|retired
+    version = Column(String(64), nullable=False)
+    body = Column(JSON, nullable=False)  # superapp_shared.risk rule set document
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    retired_at = Column(DateTime, nullable=True)
+
+
+class RiskDecision(Base):
+    __tablename__ = "risk_decisions"
+    __table_args__ = (
+        Index("ix_risk_decisions_user_created", "user_id", "created_at"),
+        Index("ix_risk_decisions_action_created", "action", "created_at"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    context = Column(String(32), nullable=False)  # p2p_transfer, qr_pay, invoice_autopay, ...
+    user_id = Column(UUID(as_uuid=True), nullable=True)  # no FK: written off the request path
+    amount_cents = Column(BigInteger, nullable=False, default=0)
+    action = Column(String(8), nullable=False)  # allow|flag|block
+    score = Column(Integer, nullable=False, default=0)
+    enforced = Column(Boolean, nullable=False, default=True)
+    version = Column(String(64), nullable=False)
+    hits = Column(JSON, nullable=True)  # [{rule, score, action?, reason?}]
+    features = Column(JSON, nullable=True)  # feature values the rules read
+    shadow = Column(JSON, nullable=True)  # [{version, action, score, hits}]
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
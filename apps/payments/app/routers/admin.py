@@ -1,15 +1,31 @@
-from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 from pydantic import BaseModel, Field
 import os
 import hashlib
 import secrets
+import uuid
+from datetime import datetime
 
 from ..config import settings
 from ..auth import get_db, create_access_token, ensure_user_and_wallet
-from ..models import WebhookEndpoint, Transfer, Wallet, Refund, LedgerEntry, User, Merchant
+from ..models import WebhookEndpoint, WebhookDelivery, Transfer, Wallet, Refund, LedgerEntry, User, Merchant, BillingRun
+from ..models import LedgerCampaign, LedgerCampaignRecipient, RiskDecision, RiskRuleSet
 from ..utils.audit import record_event
+from ..utils.billing import billing_run_out, run_invoice_autopay
+from ..utils.campaigns import (
+    add_all_users,
+    add_recipients,
+    campaign_out,
+    create_campaign,
+    recipient_out,
+    run_campaign,
+    start_campaign,
+    stop_campaign,
+)
+from ..utils.risk import get_engine
+from superapp_shared.risk import RuleError, RuleSet
 
 
 router = APIRouter(prefix="/admin", tags=["admin"]) 
@@ -253,6 +269,273 @@ def admin_requeue_delivery(delivery_id: str, db: Session = Depends(get_db), _: N
     return {"detail": "requeued"}
 
 
+@router.get("/billing_runs")
+def list_billing_runs(kind: str = "invoice_autopay", limit: int = 20, db: Session = Depends(get_db), _: None = Depends(require_admin)):
+    limit = max(1, min(200, limit))
+    rows = (
+        db.query(BillingRun)
+        .filter(BillingRun.kind == kind)
+        .order_by(BillingRun.started_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return {"items": [billing_run_out(r) for r in rows], "limit": limit}
+
+
+@router.post("/billing_runs/invoice_autopay")
+def trigger_invoice_autopay(_: None = Depends(require_admin)):
+    # Runs in its own chunked transactions, independent of the request session
+    return run_invoice_autopay()
+
+
+class CampaignRecipientIn(BaseModel):
+    user_id: str
+    amount_cents: int | None = None
+
+
+class CampaignIn(BaseModel):
+    name: str
+    kind: str = Field(description="credit | debit | fee_adjustment")
+    amount_cents: int | None = Field(default=None, description="Default per-recipient amount (signed for fee_adjustment)")
+    memo: str | None = None
+    audience: str = Field(default="explicit", description="explicit | all_users")
+    limit: int | None = None
+    offset: int = 0
+    recipients: list[CampaignRecipientIn] = Field(default_factory=list)
+    start: bool = False
+
+
+class CampaignRecipientsIn(BaseModel):
+    recipients: list[CampaignRecipientIn]
+
+
+def _get_campaign(db: Session, campaign_id: str) -> LedgerCampaign:
+    try:
+        c = db.get(LedgerCampaign, uuid.UUID(campaign_id))
+    except ValueError:
+        c = None
+    if c is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign not found")
+    return c
+
+
+def _launch(db: Session, c: LedgerCampaign, background: BackgroundTasks) -> dict:
+    start_campaign(db, c)
+    # The run uses its own chunked transactions; it must see the queued campaign
+    db.commit()
+    background.add_task(run_campaign, str(c.id))
+    return campaign_out(c)
+
+
+@router.post("/campaigns")
+def create_ledger_campaign(
+    payload: CampaignIn,
+    background: BackgroundTasks,
+    db: Session = Depends(get_db),
+    _: None = Depends(require_admin),
+):
+    c = create_campaign(db, name=payload.name, kind=payload.kind, amount_cents=payload.amount_cents, memo=payload.memo)
+    if payload.audience == "all_users":
+        added = {"added": add_all_users(db, c, limit=payload.limit, offset=payload.offset)}
+    elif payload.audience == "explicit":
+        added = add_recipients(db, c, [r.model_dump() for r in payload.recipients])
+    else:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="audience must be explicit or all_users")
+    out = _launch(db, c, background) if payload.start else campaign_out(c)
+    out["recipients_added"] = added
+    return out
+
+
+@router.post("/campaigns/{campaign_id}/recipients")
+def add_ledger_campaign_recipients(
+    campaign_id: str,
+    payload: CampaignRecipientsIn,
+    db: Session = Depends(get_db),
+    _: None = Depends(require_admin),
+):
+    c = _get_campaign(db, campaign_id)
+    added = add_recipients(db, c, [r.model_dump() for r in payload.recipients])
+    out = campaign_out(c)
+    out["recipients_added"] = added
+    return out
+
+
+@router.post("/campaigns/{campaign_id}/start")
+def start_ledger_campaign(
+    campaign_id: str,
+    background: BackgroundTasks,
+    db: Session = Depends(get_db),
+    _: None = Depends(require_admin),
+):
+    """Start a draft campaign or resume a paused/failed one; already applied recipients are never redone."""
+    return _launch(db, _get_campaign(db, campaign_id), background)
+
+
+@router.post("/campaigns/{campaign_id}/pause")
+def pause_ledger_campaign(campaign_id: str, db: Session = Depends(get_db), _: None = Depends(require_admin)):
+    return campaign_out(stop_campaign(db, _get_campaign(db, campaign_id), "paused"))
+
+
+@router.post("/campaigns/{campaign_id}/cancel")
+def cancel_ledger_campaign(campaign_id: str, db: Session = Depends(get_db), _: None = Depends(require_admin)):
+    return campaign_out(stop_campaign(db, _get_campaign(db, campaign_id), "cancelled"))
+
+
+@router.get("/campaigns")
+def list_ledger_campaigns(status_filter: str | None = Query(default=None, alias="status"), limit: int = 20, db: Session = Depends(get_db), _: None = Depends(require_admin)):
+    limit = max(1, min(200, limit))
+    q = db.query(LedgerCampaign)
+    if status_filter:
+        q = q.filter(LedgerCampaign.status == status_filter)
+    rows = q.order_by(LedgerCampaign.created_at.desc()).limit(limit).all()
+    return {"items": [campaign_out(c) for c in rows], "limit": limit}
+
+
+@router.get("/campaigns/{campaign_id}")
+def get_ledger_campaign(campaign_id: str, db: Session = Depends(get_db), _: None = Depends(require_admin)):
+    return campaign_out(_get_campaign(db, campaign_id))
+
+
+@router.get("/campaigns/{campaign_id}/recipients")
+def list_ledger_campaign_recipients(
+    campaign_id: str,
+    status_filter: str | None = Query(default=None, alias="status"),
+    after: str | None = None,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    _: None = Depends(require_admin),
+):
+    """Per-recipient results, keyset-paginated by recipient id (pass the returned ``next`` as ``after``)."""
+    c = _get_campaign(db, campaign_id)
+    limit = max(1, min(1000, limit))
+    q = db.query(LedgerCampaignRecipient).filter(LedgerCampaignRecipient.campaign_id == c.id)
+    if status_filter:
+        q = q.filter(LedgerCampaignRecipient.status == status_filter)
+    if after:
+        q = q.filter(LedgerCampaignRecipient.id > uuid.UUID(after))
+    rows = q.order_by(LedgerCampaignRecipient.id.asc()).limit(limit).all()
+    return {
+        "items": [recipient_out(r) for r in rows],
+        "next": str(rows[-1].id) if len(rows) == limit else None,
+    }
+
+
+class RiskRulesIn(BaseModel):
+    name: str
+    status: str = Field(default="shadow", description="active | shadow")
+    body: dict = Field(description="Rule set document: {version?, thresholds: {flag, block}, rules: [{id, when, score, action?, reason?}]}")
+
+
+def _rule_set_out(r: RiskRuleSet) -> dict:
+    return {
+        "id": str(r.id),
+        "name": r.name,
+        "status": r.status,
+        "version": r.version,
+        "body": r.body,
+        "created_at": r.created_at.isoformat() + "Z",
+        "retired_at": r.retired_at.isoformat() + "Z" if r.retired_at else None,
+    }
+
+
+def _reload_risk_rules() -> dict:
+    changed = get_engine().registry.reload()
+    return {"changed": changed, **get_engine().snapshot()}
+
+
+@router.get("/risk/rules")
+def list_risk_rules(include_retired: bool = False, db: Session = Depends(get_db), _: None = Depends(require_admin)):
+    q = db.query(RiskRuleSet)
+    if not include_retired:
+        q = q.filter(RiskRuleSet.status != "retired")
+    rows = q.order_by(RiskRuleSet.created_at.desc()).limit(200).all()
+    return {"items": [_rule_set_out(r) for r in rows], "engine": get_engine().snapshot()}
+
+
+@router.post("/risk/rules")
+def create_risk_rules(payload: RiskRulesIn, db: Session = Depends(get_db), _: None = Depends(require_admin)):
+    """Store a rule set; ``active`` replaces (retires) the current active set. Running engines pick it up on reload."""
+    if payload.status not in ("active", "shadow"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="status must be active or shadow")
+    try:
+        compiled = RuleSet.from_dict(payload.body)
+    except RuleError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"invalid_rules: {e}")
+    now = datetime.utcnow()
+    if payload.status == "active":
+        db.query(RiskRuleSet).filter(RiskRuleSet.status == "active").update({"status": "retired", "retired_at": now})
+    row = RiskRuleSet(name=payload.name, status=payload.status, version=compiled.version, body=payload.body, created_at=now)
+    db.add(row)
+    db.flush()
+    record_event(db, "risk.rules", None, {"id": str(row.id), "status": row.status, "version": row.version})
+    db.commit()
+    out = _rule_set_out(row)
+    out["reload"] = _reload_risk_rules()
+    return out
+
+
+@router.post("/risk/rules/{rule_set_id}/retire")
+def retire_risk_rules(rule_set_id: str, db: Session = Depends(get_db), _: None = Depends(require_admin)):
+    row = db.get(RiskRuleSet, uuid.UUID(rule_set_id))
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rule set not found")
+    if row.status != "retired":
+        row.status = "retired"
+        row.retired_at = datetime.utcnow()
+        record_event(db, "risk.rules", None, {"id": str(row.id), "status": "retired", "version": row.version})
+        db.commit()
+    out = _rule_set_out(row)
+    out["reload"] = _reload_risk_rules()
+    return out
+
+
+@router.post("/risk/reload")
+def reload_risk_rules(_: None = Depends(require_admin)):
+    return _reload_risk_rules()
+
+
+@router.get("/risk/decisions")
+def list_risk_decisions(
+    user_id: str | None = None,
+    action: str | None = None,
+    context: str | None = None,
+    limit: int = 50,
+    db: Session = Depends(get_db),
+    _: None = Depends(require_admin),
+):
+    """Stored decisions with their explanations (rules hit, feature values, shadow verdicts), newest first."""
+    get_engine().recorder.flush()
+    limit = max(1, min(500, limit))
+    q = db.query(RiskDecision)
+    if user_id:
+        q = q.filter(RiskDecision.user_id == uuid.UUID(user_id))
+    if action:
+        q = q.filter(RiskDecision.action == action)
+    if context:
+        q = q.filter(RiskDecision.context == context)
+    rows = q.order_by(RiskDecision.created_at.desc()).limit(limit).all()
+    return {
+        "items": [
+            {
+                "id": str(r.id),
+                "context": r.context,
+                "user_id": str(r.user_id) if r.user_id else None,
+                "amount_cents": r.amount_cents,
+                "action": r.action,
+                "score": r.score,
+                "enforced": r.enforced,
+                "version": r.version,
+                "hits": r.hits or [],
+                "features": r.features or {},
+                "shadow": r.shadow or [],
+                "created_at": r.created_at.isoformat() + "Z",
+            }
+            for r in rows
+        ],
+        "limit": limit,
+    }
+
+
 class AirdropIn(BaseModel):
     amount_cents: int | None = None
     limit: int = 10000
@@ -262,64 +545,25 @@ class AirdropIn(BaseModel):
 @router.post("/airdrop_starting_credit")
 def admin_airdrop_starting_credit(
     payload: AirdropIn,
+    background: BackgroundTasks,
     db: Session = Depends(get_db),
     _: None = Depends(require_admin),
 ):
     """
     Backfill starting credit to existing users who haven't received it yet.
-    Idempotent per user via idempotency_key "airdrop:<user_id>".
+    Runs as a credit campaign in the background (progress via ``GET /admin/campaigns/{id}``);
+    idempotent per user via idempotency_key "airdrop:<user_id>".
     """
     amt = int(payload.amount_cents or settings.STARTING_CREDIT_CENTS)
-    if amt <= 0:
-        return {"processed": 0, "credited": 0, "skipped": 0, "amount_cents": amt}
-
     limit = max(1, min(50000, int(payload.limit)))
     offset = max(0, int(payload.offset))
+    if amt <= 0:
+        return {"campaign_id": None, "recipients": 0, "amount_cents": amt, "limit": limit, "offset": offset}
 
-    users = (
-        db.query(User)
-        .order_by(User.created_at.asc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
-    processed = 0
-    credited = 0
-    skipped = 0
-    for u in users:
-        processed += 1
-        # Ensure wallet exists
-        w = db.query(Wallet).filter(Wallet.user_id == u.id).one_or_none()
-        if w is None:
-            w = Wallet(user_id=u.id)
-            db.add(w)
-            db.flush()
-        # Skip if already airdropped
-        idem = f"airdrop:{u.id}"
-        existing = db.query(Transfer).filter(Transfer.idempotency_key == idem).one_or_none()
-        if existing is not None:
-            skipped += 1
-            continue
-        # Credit
-        t = Transfer(
-            from_wallet_id=None,
-            to_wallet_id=w.id,
-            amount_cents=amt,
-            currency_code=w.currency_code,
-            status="completed",
-            idempotency_key=idem,
-        )
-        db.add(t)
-        db.flush()
-        db.add(LedgerEntry(transfer_id=t.id, wallet_id=w.id, amount_cents_signed=amt))
-        w.balance_cents = w.balance_cents + amt
-        credited += 1
-        try:
-            record_event(db, "wallet.airdrop.admin", str(u.id), {"amount_cents": amt})
-        except Exception:
-            pass
-    db.flush()
-    return {"processed": processed, "credited": credited, "skipped": skipped, "amount_cents": amt, "limit": limit, "offset": offset}
+    c = create_campaign(db, name="starting credit airdrop", kind="credit", amount_cents=amt)
+    add_all_users(db, c, limit=limit, offset=offset, idempotency_prefix="airdrop:")
+    out = _launch(db, c, background)
+    return {"campaign_id": out["id"], "recipients": out["recipient_count"], "amount_cents": amt, "limit": limit, "offset": offset}
 
 
 class DemoSeedIn(BaseModel):
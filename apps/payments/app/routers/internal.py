@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, Header, HTTPException, status, Request
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from ..config import settings
@@ -225,6 +226,34 @@ def internal_get_request(request_id: str, db: Session = Depends(get_db), secret:
     }
 
 
+@router.post("/requests/cancel")
+def internal_cancel_request(payload: dict, db: Session = Depends(get_db), secret: str | None = Header(default=None, alias="X-Internal-Secret"), sign: str | None = Header(default=None, alias="X-Internal-Sign"), ts: str | None = Header(default=None, alias="X-Internal-Ts")):
+    """Withdraw the pending request created under ``idempotency_key`` on behalf of the service that made it; idempotent.
+
+    Callers use the key because they may not know the id: the answer to their create call can be lost.
+    """
+    authorized = False
+    if settings.INTERNAL_API_SECRET:
+        if sign and ts:
+            authorized = verify_hmac_and_prevent_replay(ts, payload, sign)
+        elif not settings.INTERNAL_REQUIRE_HMAC and secret == settings.INTERNAL_API_SECRET:
+            authorized = True
+    if not authorized:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    idem = payload.get("idempotency_key")
+    if not isinstance(idem, str) or not idem or len(idem) > 64:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid payload")
+    pr = db.execute(select(PaymentRequest).where(PaymentRequest.idempotency_key == idem).with_for_update()).scalars().first()
+    if pr is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    if pr.status == "pending":
+        pr.status = "canceled"
+        pr.updated_at = datetime.utcnow()
+        db.flush()
+    # Anything else was settled (or withdrawn) first; the caller decides what that means for its booking
+    return {"id": str(pr.id), "status": pr.status}
+
+
 @router.post("/invoices")
 def create_invoice_internal(
     payload: dict,
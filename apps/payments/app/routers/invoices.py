@@ -6,7 +6,6 @@ from sqlalchemy.exc import IntegrityError
 
 from ..auth import get_current_user, get_db, ensure_user_and_wallet
 from ..config import settings
-from ..database import SessionLocal
 from ..models import User, Wallet, Invoice, EBillMandate, Transfer, LedgerEntry
 from ..schemas import (
     InvoiceCreateIn,
@@ -21,6 +20,7 @@ from ..utils.kyc_policy import enforce_tx_limits, require_min_kyc_level
 from ..utils.audit import record_event
 from ..utils.risk import evaluate_risk_and_maybe_block
 from ..utils.idempotency_store import reserve as idem_reserve, finalize as idem_finalize
+from ..utils.billing import run_invoice_autopay
 
 
 router = APIRouter(prefix="/invoices", tags=["invoices"])
@@ -277,48 +277,13 @@ def process_due_invoices(user: User = Depends(get_current_user), db: Session = D
     return {"processed": processed, "errors": errors}
 
 
-def process_all_due_once():
-    """Process all due invoices for all payers with active autopay mandates (best-effort)."""
-    db = SessionLocal()
-    try:
-        now = datetime.utcnow()
-        # Fetch a batch of due invoices with active autopay mandate
-        # We avoid joins for simplicity and iterate with filters
-        due = (
-            db.query(Invoice)
-            .filter(Invoice.status == "pending")
-            .filter(Invoice.due_at <= now)
-            .order_by(Invoice.due_at.asc())
-            .limit(500)
-            .all()
-        )
-        processed = 0
-        for inv in due:
-            m = (
-                db.query(EBillMandate)
-                .filter(
-                    EBillMandate.payer_user_id == inv.payer_user_id,
-                    EBillMandate.issuer_user_id == inv.issuer_user_id,
-                    EBillMandate.status == "active",
-                )
-                .one_or_none()
-            )
-            if not m or not m.autopay:
-                continue
-            if m.max_amount_cents is not None and inv.amount_cents > m.max_amount_cents:
-                continue
-            try:
-                payer = db.get(User, inv.payer_user_id)
-                idem = f"auto-invoice-{inv.id}"
-                pay_invoice(str(inv.id), user=payer, db=db, idem_key=idem)  # type: ignore[arg-type]
-                processed += 1
-            except Exception:
-                db.rollback()
-                continue
-        db.commit()
-        return {"processed": processed}
-    finally:
-        db.close()
+def process_all_due_once(where=None):
+    """Charge all due invoices with an active autopay mandate as one billing run.
+
+    ``where`` is an optional extra filter (e.g. the scheduler's partition clause).
+    See ``utils.billing`` for batching, locking and the run report.
+    """
+    return run_invoice_autopay(where=where)
 
 
 @router.post("/mandates", response_model=MandateOut)
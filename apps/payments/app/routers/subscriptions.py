@@ -171,14 +171,16 @@ def process_due(user: User = Depends(get_current_user), db: Session = Depends(ge
     # Dev‑only processing helper
     if settings.ENV != "dev":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    return process_due_once(db, max_count=max_count)
+
+
+def process_due_once(db: Session, max_count: int = 50, where=None):
+    """Charge due active subscriptions and schedule their next charge (caller commits)."""
     now = datetime.utcnow()
-    due = (
-        db.query(Subscription)
-        .filter(Subscription.status == "active", Subscription.next_charge_at <= now)
-        .order_by(Subscription.next_charge_at.asc())
-        .limit(max_count)
-        .all()
-    )
+    q = db.query(Subscription).filter(Subscription.status == "active", Subscription.next_charge_at <= now)
+    if where is not None:
+        q = q.filter(where)
+    due = q.order_by(Subscription.next_charge_at.asc()).limit(max_count).with_for_update(skip_locked=True).all()
     processed = 0
     for s in due:
         ok = False
@@ -1,20 +1,23 @@
-from datetime import datetime
-import secrets
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi import Response
+import uuid
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from ..auth import get_current_user, get_db, ensure_user_and_wallet
-from ..models import User, Wallet, Transfer, LedgerEntry, TopupVoucher
+from ..auth import get_current_user, get_db
+from ..config import settings
+from ..models import User, TopupVoucher
 from ..schemas import (
     VoucherCreateIn,
     VoucherOut,
     VouchersListOut,
     VouchersBulkCreateIn,
+    VoucherBatchCreateIn,
+    VoucherBatchOut,
     VouchersAdminSummaryOut,
     VoucherAdminItem,
     VouchersAdminListOut,
 )
+from ..utils import vouchers as vouchers_svc
 from .admin import require_admin
 
 
@@ -39,23 +42,14 @@ def _to_out(v: TopupVoucher) -> VoucherOut:
 def create_voucher(payload: VoucherCreateIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if payload.amount_syp <= 0:
         raise HTTPException(status_code=400, detail="Invalid amount")
-    # Generate unique code (short, URL-safe)
-    # 16 bytes => 22 chars URL-safe base64 (we'll hex to keep simple)
-    for _ in range(5):
-        code = secrets.token_hex(8)
-        if db.query(TopupVoucher).filter(TopupVoucher.code == code).one_or_none() is None:
-            break
-    else:
-        raise HTTPException(status_code=500, detail="Could not generate code")
-    v = TopupVoucher(
-        code=code,
+    batch = vouchers_svc.issue_vouchers(
+        db,
+        count=1,
         amount_cents=payload.amount_syp * 100,
         currency_code=payload.currency_code or "SYP",
-        status="active",
         created_by_user_id=user.id,
     )
-    db.add(v)
-    db.flush()
+    v = db.query(TopupVoucher).filter(TopupVoucher.batch_id == batch.batch_id).one()
     return _to_out(v)
 
 
@@ -73,59 +67,8 @@ def list_my_vouchers(user: User = Depends(get_current_user), db: Session = Depen
 
 @router.post("/{code}/redeem", response_model=VoucherOut)
 def redeem_voucher(code: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    v = db.query(TopupVoucher).filter(TopupVoucher.code == code).with_for_update().one_or_none()
-    if v is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voucher not found")
-    if v.status != "active":
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Voucher not active")
-    if v.amount_cents <= 0:
-        raise HTTPException(status_code=400, detail="Invalid voucher amount")
-
-    # Compute fee (default 1%) and split mint between user and fee wallet
-    total = int(v.amount_cents)
-    from ..config import settings
-    bps = max(0, int(getattr(settings, "VOUCHER_FEE_BPS", 100)))
-    fee = int((total * bps + 5000) // 10000)
-    fee = min(max(0, fee), total)
-    net = total - fee
-
-    # Credit user's wallet (net)
-    w = db.query(Wallet).filter(Wallet.user_id == user.id).with_for_update().one()
-    t_user = Transfer(
-        from_wallet_id=None,
-        to_wallet_id=w.id,
-        amount_cents=net,
-        currency_code=w.currency_code,
-        status="completed",
-        idempotency_key=f"voucher:{v.code}:net",
-    )
-    db.add(t_user)
-    db.flush()
-    db.add(LedgerEntry(transfer_id=t_user.id, wallet_id=w.id, amount_cents_signed=net))
-    w.balance_cents = w.balance_cents + net
-
-    # Credit fee wallet (fee), if fee > 0
-    if fee > 0:
-        fee_phone = settings.FEE_WALLET_PHONE
-        fee_user = ensure_user_and_wallet(db, fee_phone, name="Platform Fee")
-        fee_wallet = db.query(Wallet).filter(Wallet.user_id == fee_user.id).with_for_update().one()
-        t_fee = Transfer(
-            from_wallet_id=None,
-            to_wallet_id=fee_wallet.id,
-            amount_cents=fee,
-            currency_code=fee_wallet.currency_code,
-            status="completed",
-            idempotency_key=f"voucher:{v.code}:fee",
-        )
-        db.add(t_fee)
-        db.flush()
-        db.add(LedgerEntry(transfer_id=t_fee.id, wallet_id=fee_wallet.id, amount_cents_signed=fee))
-        fee_wallet.balance_cents = fee_wallet.balance_cents + fee
-
-    v.status = "redeemed"
-    v.redeemed_by_user_id = user.id
-    v.redeemed_at = datetime.utcnow()
-    db.flush()
+    # Single use is enforced by a conditional UPDATE (active -> redeemed), see utils/vouchers
+    v = vouchers_svc.redeem_voucher(db, code, user)
     return _to_out(v)
 
 
@@ -138,37 +81,48 @@ def admin_vouchers_bulk(
 ):
     if payload.amount_syp <= 0:
         raise HTTPException(status_code=400, detail="Invalid amount")
-    count = int(payload.count)
-    items: list[TopupVoucher] = []
-    prefix = (payload.prefix or "").strip()
-    if prefix:
-        # sanitize: alnum only
-        import re
-        if not re.fullmatch(r"[A-Za-z0-9_-]{1,10}", prefix):
-            raise HTTPException(status_code=400, detail="Invalid prefix")
-    for _ in range(count):
-        for _try in range(5):
-            code = secrets.token_hex(8)
-            if prefix:
-                code = f"{prefix}{code}"
-            if db.query(TopupVoucher).filter(TopupVoucher.code == code).one_or_none() is None:
-                v = TopupVoucher(
-                    code=code,
-                    amount_cents=payload.amount_syp * 100,
-                    currency_code=payload.currency_code or "SYP",
-                    status="active",
-                    created_by_user_id=user.id,
-                )
-                db.add(v)
-                items.append(v)
-                break
-        else:
-            raise HTTPException(status_code=500, detail="Failed to generate unique code")
-    db.flush()
-    # Return most recent created items
+    prefix = vouchers_svc.validate_prefix(payload.prefix)
+    batch = vouchers_svc.issue_vouchers(
+        db,
+        count=int(payload.count),
+        amount_cents=payload.amount_syp * 100,
+        currency_code=payload.currency_code or "SYP",
+        created_by_user_id=user.id,
+        prefix=prefix,
+    )
+    items = db.query(TopupVoucher).filter(TopupVoucher.batch_id == batch.batch_id).order_by(TopupVoucher.code).all()
     return VouchersListOut(items=[_to_out(v) for v in items])
 
 
+@router.post("/admin/batches", response_model=VoucherBatchOut)
+def admin_voucher_batch(
+    payload: VoucherBatchCreateIn,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    _: None = Depends(require_admin),
+):
+    """Issue a large batch; fetch the codes with ``/admin/export?batch_id=``."""
+    if payload.count > settings.VOUCHER_BATCH_MAX_COUNT:
+        raise HTTPException(status_code=400, detail=f"count exceeds {settings.VOUCHER_BATCH_MAX_COUNT}")
+    prefix = vouchers_svc.validate_prefix(payload.prefix)
+    batch = vouchers_svc.issue_vouchers(
+        db,
+        count=int(payload.count),
+        amount_cents=payload.amount_syp * 100,
+        currency_code=payload.currency_code or "SYP",
+        created_by_user_id=user.id,
+        prefix=prefix,
+    )
+    return VoucherBatchOut(
+        batch_id=str(batch.batch_id),
+        count=batch.count,
+        amount_syp=payload.amount_syp,
+        currency_code=payload.currency_code or "SYP",
+        prefix=prefix or None,
+        export_url=f"/vouchers/admin/export?batch_id={batch.batch_id}",
+    )
+
+
 @router.get("/admin/summary", response_model=VouchersAdminSummaryOut)
 def admin_vouchers_summary(
     created_by: str | None = None,  # "me" to restrict to current user
@@ -176,17 +130,13 @@ def admin_vouchers_summary(
     db: Session = Depends(get_db),
     _: None = Depends(require_admin),
 ):
-    q = db.query(TopupVoucher)
-    if created_by == "me":
-        q = q.filter(TopupVoucher.created_by_user_id == user.id)
-    rows = q.all()
-    total = len(rows)
-    active = sum(1 for v in rows if v.status == "active")
-    redeemed = sum(1 for v in rows if v.status == "redeemed")
-    revoked = sum(1 for v in rows if v.status == "revoked")
-    sum_total_cents = sum(int(v.amount_cents) for v in rows)
-    sum_redeemed_cents = sum(int(v.amount_cents) for v in rows if v.status == "redeemed")
-    from ..config import settings
+    # Served from the voucher_stats counters, kept current by every issue/redeem/revoke
+    by_status = vouchers_svc.voucher_summary(db, created_by=user.id if created_by == "me" else None)
+    active, active_cents = by_status["active"]
+    redeemed, sum_redeemed_cents = by_status["redeemed"]
+    revoked, revoked_cents = by_status["revoked"]
+    total = active + redeemed + revoked
+    sum_total_cents = active_cents + sum_redeemed_cents + revoked_cents
     bps = max(0, int(getattr(settings, "VOUCHER_FEE_BPS", 100)))
     fees_cents = (sum_redeemed_cents * bps + 5000) // 10000
     net_cents = sum_redeemed_cents - fees_cents
@@ -251,13 +201,7 @@ def admin_voucher_revoke(
     db: Session = Depends(get_db),
     _: None = Depends(require_admin),
 ):
-    v = db.query(TopupVoucher).filter(TopupVoucher.code == code).with_for_update().one_or_none()
-    if v is None:
-        raise HTTPException(status_code=404, detail="Voucher not found")
-    if v.status != "active":
-        raise HTTPException(status_code=400, detail="Cannot revoke non-active voucher")
-    v.status = "revoked"
-    db.flush()
+    v = vouchers_svc.revoke_voucher(db, code)
     return _to_out(v)
 
 
@@ -266,38 +210,23 @@ def admin_vouchers_export(
     status: str | None = None,
     prefix: str | None = None,
     created_by: str | None = None,
+    batch_id: str | None = None,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
     _: None = Depends(require_admin),
 ):
-    # Produce CSV with columns: code,amount_syp,status,created_at,redeemed_at,created_by_phone,redeemed_by_phone,qr_text
-    q = db.query(TopupVoucher)
-    if status in {"active", "redeemed", "revoked"}:
-        q = q.filter(TopupVoucher.status == status)
-    if prefix:
-        q = q.filter(TopupVoucher.code.like(f"{prefix}%"))
-    if created_by == "me":
-        q = q.filter(TopupVoucher.created_by_user_id == user.id)
-    rows = q.order_by(TopupVoucher.created_at.desc()).all()
-    import csv
-    from io import StringIO
-    buf = StringIO()
-    w = csv.writer(buf)
-    w.writerow(["code", "amount_syp", "status", "created_at", "redeemed_at", "created_by_phone", "redeemed_by_phone", "qr_text"])
-    for v in rows:
-        creator = db.get(User, v.created_by_user_id) if v.created_by_user_id else None
-        redeemer = db.get(User, v.redeemed_by_user_id) if v.redeemed_by_user_id else None
-        w.writerow([
-            v.code,
-            int(v.amount_cents // 100),
-            v.status,
-            (v.created_at.isoformat() + "Z") if v.created_at else "",
-            (v.redeemed_at.isoformat() + "Z") if v.redeemed_at else "",
-            (creator.phone if creator else ""),
-            (redeemer.phone if redeemer else ""),
-            f"VCHR|{v.code}",
-        ])
-    return Response(buf.getvalue(), media_type="text/csv")
+    # CSV columns: code,amount_syp,status,created_at,redeemed_at,created_by_phone,redeemed_by_phone,qr_text
+    try:
+        batch = uuid.UUID(batch_id) if batch_id else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid batch_id")
+    rows = vouchers_svc.export_csv(
+        status_filter=status,
+        prefix=prefix,
+        created_by=user.id if created_by == "me" else None,
+        batch_id=batch,
+    )
+    filename = f"vouchers-{batch}.csv" if batch else "vouchers.csv"
+    return StreamingResponse(rows, media_type="text/csv", headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
 @router.get("/admin/fees/entries")
@@ -209,7 +209,7 @@ def p2p_transfer(
     check_p2p_velocity(db, user, payload.amount_cents)
     # Risk engine (optional)
     try:
-        evaluate_risk_and_maybe_block(db, user, payload.amount_cents, context="p2p_transfer")
+        evaluate_risk_and_maybe_block(db, user, payload.amount_cents, context="p2p_transfer", counterparty_user_id=str(recipient.id))
     except HTTPException:
         raise
 
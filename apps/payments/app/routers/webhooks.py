@@ -122,19 +122,16 @@ def _should_attempt(created_at: datetime, attempt_count: int) -> bool:
     return datetime.utcnow() >= created_at + timedelta(seconds=delay)
 
 
-def _process_once(db: Session, limit: int = 20):
+def _process_once(db: Session, limit: int = 20, where=None):
     max_attempts = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
     now = datetime.utcnow()
-    pending = (
-        db.query(WebhookDelivery)
-        .filter(
-            WebhookDelivery.status == "pending",
-            or_(WebhookDelivery.next_attempt_at == None, WebhookDelivery.next_attempt_at <= now),  # noqa: E711
-        )
-        .order_by(WebhookDelivery.created_at.asc())
-        .limit(limit)
-        .all()
+    q = db.query(WebhookDelivery).filter(
+        WebhookDelivery.status == "pending",
+        or_(WebhookDelivery.next_attempt_at == None, WebhookDelivery.next_attempt_at <= now),  # noqa: E711
     )
+    if where is not None:
+        q = q.filter(where)
+    pending = q.order_by(WebhookDelivery.created_at.asc()).limit(limit).all()
     for d in pending:
         if d.attempt_count >= max_attempts:
             d.status = "failed"
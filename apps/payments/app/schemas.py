@@ -217,6 +217,23 @@ class VouchersBulkCreateIn(BaseModel):
     prefix: Optional[str] = Field(default=None, max_length=10)
 
 
+class VoucherBatchCreateIn(BaseModel):
+    # Amount in SYP (not cents); count is capped by VOUCHER_BATCH_MAX_COUNT
+    amount_syp: int = Field(gt=0)
+    count: int = Field(ge=1)
+    currency_code: str = "SYP"
+    prefix: Optional[str] = Field(default=None, max_length=10)
+
+
+class VoucherBatchOut(BaseModel):
+    batch_id: str
+    count: int
+    amount_syp: int
+    currency_code: str
+    prefix: Optional[str] = None
+    export_url: str
+
+
 class VouchersAdminSummaryOut(BaseModel):
     total_count: int
     active_count: int
@@ -0,0 +1,398 @@
+"""Batched invoice autopay billing run.
+
+The sweep used to look up the mandate of every due invoice separately and
+then call ``pay_invoice`` (payer/issuer wallet locks, KYC sum, audit flush)
+per row. A billing run instead:
+
+- reads due invoices joined with their active autopay mandate in one query,
+- groups invoices by payer; a payer's invoices are never split across
+  chunks, so each payer wallet is locked once per run,
+- applies each chunk in one transaction: wallets locked in id order,
+  invoices re-checked with ``SKIP LOCKED``, transfers/ledger/audit rows
+  inserted in bulk, balances and invoice status updated from a VALUES list,
+- isolates failures: per-item checks (balance, currency, KYC limits, mandate
+  cap) only skip that invoice, and a chunk that fails in the database is
+  retried one invoice per transaction,
+- records counts, amounts and failure reasons in ``billing_runs``.
+
+Transfers keep the ``auto-invoice-<id>`` idempotency key used by
+``/invoices/process_due``, so either path can run without double charging.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Integer, and_, column, func, insert, select, update, values
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Session
+from superapp_shared.risk import RiskEvent
+
+from ..config import settings
+from ..database import SessionLocal
+from ..models import AuditEvent, BillingRun, EBillMandate, Invoice, LedgerEntry, Transfer, User, Wallet
+from .event_stream import publish
+from .kyc_policy import _limits_for_level, _start_of_day_utc
+from .risk import evaluate_risk_and_maybe_block, observe_ledger
+
+
+FAILURE_SAMPLE = 100
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class DueInvoice:
+    id: uuid.UUID
+    payer_user_id: uuid.UUID
+    issuer_user_id: uuid.UUID
+    amount_cents: int
+    due_at: datetime
+    max_amount_cents: Optional[int]
+
+    @property
+    def idem_key(self) -> str:
+        return f"auto-invoice-{self.id}"
+
+
+@dataclass
+class RunReport:
+    scanned: int = 0
+    paid_count: int = 0
+    paid_cents: int = 0
+    skipped_count: int = 0
+    failed_count: int = 0
+    failed_cents: int = 0
+    chunks: int = 0
+    reasons: Counter = field(default_factory=Counter)
+    failures: List[dict] = field(default_factory=list)
+    paid_ids: List[str] = field(default_factory=list)
+
+    def paid(self, d: DueInvoice) -> None:
+        self.paid_count += 1
+        self.paid_cents += d.amount_cents
+        self.paid_ids.append(str(d.id))
+
+    def skip(self, d: DueInvoice, reason: str) -> None:
+        self.skipped_count += 1
+        self.reasons[reason] += 1
+
+    def fail(self, d: DueInvoice, reason: str) -> None:
+        self.failed_count += 1
+        self.failed_cents += d.amount_cents
+        self.reasons[reason] += 1
+        if len(self.failures) < FAILURE_SAMPLE:
+            self.failures.append({"invoice_id": str(d.id), "reason": reason})
+
+    def merge(self, other: "RunReport") -> None:
+        for name in ("paid_count", "paid_cents", "skipped_count", "failed_count", "failed_cents", "chunks"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.reasons.update(other.reasons)
+        self.failures.extend(other.failures[: max(0, FAILURE_SAMPLE - len(self.failures))])
+        self.paid_ids.extend(other.paid_ids)
+
+    def apply_to(self, run: BillingRun) -> None:
+        run.scanned_count = self.scanned
+        run.paid_count = self.paid_count
+        run.paid_cents = self.paid_cents
+        run.skipped_count = self.skipped_count
+        run.failed_count = self.failed_count
+        run.failed_cents = self.failed_cents
+        run.chunks = self.chunks
+        run.reasons = dict(self.reasons)
+        run.failures = list(self.failures)
+
+
+def billing_run_out(run: BillingRun) -> dict:
+    return {
+        "id": str(run.id),
+        "kind": run.kind,
+        "status": run.status,
+        "scanned": run.scanned_count,
+        "paid_count": run.paid_count,
+        "paid_cents": run.paid_cents,
+        "skipped_count": run.skipped_count,
+        "failed_count": run.failed_count,
+        "failed_cents": run.failed_cents,
+        "chunks": run.chunks,
+        "reasons": run.reasons or {},
+        "failures": run.failures or [],
+        "error": run.error,
+        "started_at": run.started_at.isoformat() + "Z",
+        "finished_at": run.finished_at.isoformat() + "Z" if run.finished_at else None,
+    }
+
+
+def load_due(db: Session, now: datetime, where=None, limit: Optional[int] = None) -> List[DueInvoice]:
+    """Due pending invoices that have an active autopay mandate, oldest first."""
+    q = (
+        select(
+            Invoice.id,
+            Invoice.payer_user_id,
+            Invoice.issuer_user_id,
+            Invoice.amount_cents,
+            Invoice.due_at,
+            EBillMandate.max_amount_cents,
+        )
+        .join(
+            EBillMandate,
+            and_(
+                EBillMandate.payer_user_id == Invoice.payer_user_id,
+                EBillMandate.issuer_user_id == Invoice.issuer_user_id,
+            ),
+        )
+        .where(
+            Invoice.status == "pending",
+            Invoice.due_at <= now,
+            EBillMandate.status == "active",
+            EBillMandate.autopay.is_(True),
+        )
+        .order_by(Invoice.due_at.asc(), Invoice.id.asc())
+    )
+    if where is not None:
+        q = q.where(where)
+    if limit:
+        q = q.limit(limit)
+    return [DueInvoice(*row) for row in db.execute(q)]
+
+
+def chunk_by_payer(items: Iterable[DueInvoice], chunk_size: int) -> List[List[DueInvoice]]:
+    """Group by payer (keeping due order inside a group) and pack whole groups into chunks."""
+    groups: dict = {}
+    for d in items:
+        groups.setdefault(d.payer_user_id, []).append(d)
+    chunks: List[List[DueInvoice]] = []
+    cur: List[DueInvoice] = []
+    for group in groups.values():
+        if cur and len(cur) + len(group) > chunk_size:
+            chunks.append(cur)
+            cur = []
+        cur.extend(group)
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+def _uuid_values(name: str, *cols, rows):
+    return values(*[column(c, t) for c, t in cols], name=name).data(rows)
+
+
+def _risk_enabled() -> bool:
+    return os.getenv("FRAUD_RISK_ENABLED", "false").lower() == "true"
+
+
+def charge_chunk(db: Session, chunk: List[DueInvoice]) -> Tuple[RunReport, List[dict]]:
+    """Charge one chunk in the current transaction (caller commits or rolls back).
+
+    Returns the chunk report and the audit events to publish once committed.
+    """
+    rep = RunReport(chunks=1)
+    ts = datetime.utcnow()
+    user_ids = {d.payer_user_id for d in chunk} | {d.issuer_user_id for d in chunk}
+    wallets = {
+        w.user_id: w
+        for w in db.execute(
+            select(Wallet.id, Wallet.user_id, Wallet.balance_cents, Wallet.currency_code)
+            .where(Wallet.user_id.in_(user_ids))
+            .order_by(Wallet.id)
+            .with_for_update()
+        )
+    }
+    pending = set(
+        db.scalars(
+            select(Invoice.id)
+            .where(Invoice.id.in_([d.id for d in chunk]), Invoice.status == "pending")
+            .with_for_update(skip_locked=True)
+        )
+    )
+    charged = dict(
+        db.execute(
+            select(Transfer.idempotency_key, Transfer.id).where(Transfer.idempotency_key.in_([d.idem_key for d in chunk]))
+        ).all()
+    )
+    payer_ids = {d.payer_user_id for d in chunk}
+    kyc = dict(db.execute(select(User.id, User.kyc_level).where(User.id.in_(payer_ids))).all())
+    payer_wallet_ids = [wallets[u].id for u in payer_ids if u in wallets]
+    spent_today = dict(
+        db.execute(
+            select(LedgerEntry.wallet_id, func.sum(LedgerEntry.amount_cents_signed))
+            .where(
+                LedgerEntry.wallet_id.in_(payer_wallet_ids),
+                LedgerEntry.amount_cents_signed < 0,
+                LedgerEntry.created_at >= _start_of_day_utc(),
+            )
+            .group_by(LedgerEntry.wallet_id)
+        ).all()
+    )
+    balance = {w.id: w.balance_cents for w in wallets.values()}
+    spent = {wid: abs(int(v or 0)) for wid, v in spent_today.items()}
+    risk_enabled = _risk_enabled()
+
+    transfers, entries, audits, paid_rows = [], [], [], []
+    delta: Counter = Counter()
+    for d in chunk:
+        if d.id not in pending:
+            rep.skip(d, "not_pending")
+            continue
+        if d.idem_key in charged:
+            # Charged earlier (e.g. /invoices/process_due) but not marked paid yet
+            paid_rows.append((d.id, charged[d.idem_key]))
+            rep.skip(d, "already_charged")
+            continue
+        pw, iw = wallets.get(d.payer_user_id), wallets.get(d.issuer_user_id)
+        if pw is None or iw is None:
+            rep.fail(d, "wallet_missing")
+            continue
+        if pw.currency_code != iw.currency_code:
+            rep.fail(d, "currency_mismatch")
+            continue
+        amount = d.amount_cents
+        tx_max, daily_max = _limits_for_level(int(kyc.get(d.payer_user_id) or 0))
+        if amount <= 0:
+            rep.fail(d, "invalid_amount")
+            continue
+        if amount > tx_max:
+            rep.fail(d, "kyc_tx_limit")
+            continue
+        if spent.get(pw.id, 0) + amount > daily_max:
+            rep.fail(d, "kyc_daily_limit")
+            continue
+        if balance[pw.id] < amount:
+            rep.fail(d, "insufficient_balance")
+            continue
+        if risk_enabled:
+            try:
+                evaluate_risk_and_maybe_block(
+                    db, db.get(User, d.payer_user_id), amount, context="invoice_autopay", merchant_user_id=str(d.issuer_user_id)
+                )
+            except HTTPException as e:
+                rep.fail(d, str(e.detail))
+                continue
+        tid = uuid.uuid4()
+        transfers.append({
+            "id": tid,
+            "from_wallet_id": pw.id,
+            "to_wallet_id": iw.id,
+            "amount_cents": amount,
+            "currency_code": pw.currency_code,
+            "status": "completed",
+            "idempotency_key": d.idem_key,
+            "created_at": ts,
+        })
+        entries.append({"id": uuid.uuid4(), "transfer_id": tid, "wallet_id": pw.id, "amount_cents_signed": -amount, "created_at": ts})
+        entries.append({"id": uuid.uuid4(), "transfer_id": tid, "wallet_id": iw.id, "amount_cents_signed": amount, "created_at": ts})
+        audits.append({
+            "id": uuid.uuid4(),
+            "type": "invoices.pay",
+            "user_id": d.payer_user_id,
+            "data": {"invoice_id": str(d.id), "amount_cents": amount, "autopay": True},
+            "created_at": ts,
+        })
+        balance[pw.id] -= amount
+        balance[iw.id] += amount
+        spent[pw.id] = spent.get(pw.id, 0) + amount
+        delta[pw.id] -= amount
+        delta[iw.id] += amount
+        paid_rows.append((d.id, tid))
+        rep.paid(d)
+
+    if transfers:
+        db.execute(insert(Transfer.__table__), transfers)
+        db.execute(insert(LedgerEntry.__table__), entries)
+        db.execute(insert(AuditEvent.__table__), audits)
+    moved = [(wid, v) for wid, v in delta.items() if v]
+    if moved:
+        v = _uuid_values("v", ("id", UUID(as_uuid=True)), ("delta", Integer), rows=moved)
+        db.execute(
+            update(Wallet).where(Wallet.id == v.c.id).values(balance_cents=Wallet.balance_cents + v.c.delta),
+            execution_options={"synchronize_session": False},
+        )
+    if paid_rows:
+        p = _uuid_values("p", ("id", UUID(as_uuid=True)), ("tid", UUID(as_uuid=True)), rows=paid_rows)
+        db.execute(
+            update(Invoice).where(Invoice.id == p.c.id).values(status="paid", paid_transfer_id=p.c.tid, updated_at=ts),
+            execution_options={"synchronize_session": False},
+        )
+    return rep, audits
+
+
+def _charge_isolated(db: Session, chunk: List[DueInvoice], report: RunReport) -> None:
+    try:
+        rep, audits = charge_chunk(db, chunk)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        log.warning("billing chunk of %d invoices failed", len(chunk), exc_info=True)
+        if len(chunk) == 1:
+            report.fail(chunk[0], f"error:{type(e).__name__}")
+            return
+        # One bad row must not fail its neighbours: retry one invoice per transaction
+        for d in chunk:
+            _charge_isolated(db, [d], report)
+        return
+    report.merge(rep)
+    paid = set(rep.paid_ids)
+    observe_ledger(
+        RiskEvent("invoice_autopay", str(d.payer_user_id), d.amount_cents, counterparty=str(d.issuer_user_id)) for d in chunk if str(d.id) in paid
+    )
+    for ev in audits:
+        try:
+            publish(ev["type"], ev["data"])
+        except Exception:
+            pass
+
+
+def run_invoice_autopay(
+    where=None,
+    *,
+    now: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> dict:
+    """Charge all due autopay invoices (optionally narrowed by ``where``) and record a billing run."""
+    now = now or datetime.utcnow()
+    limit = settings.INVOICE_AUTOPAY_MAX_PER_RUN if limit is None else limit
+    chunk_size = chunk_size or settings.INVOICE_AUTOPAY_CHUNK_SIZE
+    db = session_factory()
+    run = BillingRun(kind="invoice_autopay", status="running", started_at=datetime.utcnow())
+    report = RunReport()
+    try:
+        db.add(run)
+        db.commit()
+        due = load_due(db, now, where=where, limit=limit)
+        db.commit()  # release the snapshot before the chunk transactions
+        report.scanned = len(due)
+        eligible = []
+        for d in due:
+            if d.max_amount_cents is not None and d.amount_cents > d.max_amount_cents:
+                report.skip(d, "over_mandate_limit")
+            else:
+                eligible.append(d)
+        for chunk in chunk_by_payer(eligible, chunk_size):
+            _charge_isolated(db, chunk, report)
+        run.status = "completed"
+    except Exception as e:
+        db.rollback()
+        run.status = "failed"
+        run.error = f"{type(e).__name__}: {e}"[:512]
+        raise
+    finally:
+        try:
+            report.apply_to(run)
+            run.finished_at = datetime.utcnow()
+            db.add(run)
+            db.commit()
+        except Exception:
+            db.rollback()
+        out = billing_run_out(run)
+        db.close()
+    out["processed"] = report.paid_count
+    out["paid_invoice_ids"] = report.paid_ids[:FAILURE_SAMPLE]
+    return out
@@ -0,0 +1,578 @@
+"""Bulk ledger campaigns: mass credits, debits and fee adjustments.
+
+A campaign is a definition (kind, default amount, memo) plus one
+``ledger_campaign_recipients`` row per user. Running it:
+
+- claims the campaign for one worker (``worker_id`` + ``heartbeat_at``); a
+  worker whose heartbeat went stale is taken over by the next claim,
+- walks pending recipients in id order and applies them in chunked
+  transactions: recipients re-checked with ``SKIP LOCKED``, wallets locked in
+  id order, transfers/ledger rows inserted in bulk, balances and recipient
+  status updated from a VALUES list, campaign counters bumped in the same
+  transaction — so progress survives a crash exactly as far as the ledger,
+- is fenced: a chunk only commits while the campaign is still ``running``
+  for this worker, so pausing/cancelling or a takeover stops it cleanly.
+
+Each recipient's transfer carries an idempotency key (``camp-<recipient id>``
+unless the campaign set one, e.g. ``airdrop:<user_id>``) and the recipient
+row moves out of ``pending`` with it, so resuming or rerunning never applies
+a recipient twice.
+
+Kinds (amounts from the recipient's point of view):
+
+- ``credit``: system -> wallet (no source wallet, like the starting credit),
+- ``debit``: wallet -> fee wallet,
+- ``fee_adjustment``: positive amounts refund from the fee wallet, negative
+  amounts charge the wallet into the fee wallet.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, String, cast, func, insert, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy.orm import Session
+
+from superapp_shared.bulk import unnest_rows
+
+from ..config import settings
+from ..database import SessionLocal
+from ..models import LedgerCampaign, LedgerCampaignRecipient, LedgerEntry, Transfer, User, Wallet
+from .audit import record_event
+from .fees import ensure_fee_wallet
+
+
+KINDS = ("credit", "debit", "fee_adjustment")
+STARTABLE = ("draft", "paused", "failed")
+INSERT_BATCH = 5000
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Recipient:
+    id: uuid.UUID
+    user_id: uuid.UUID
+    amount_cents: int
+    idempotency_key: Optional[str]
+
+    @property
+    def idem_key(self) -> str:
+        return self.idempotency_key or f"camp-{self.id}"
+
+
+@dataclass
+class Plan:
+    """What a worker needs to know about the campaign it runs."""
+
+    id: uuid.UUID
+    kind: str
+    currency_code: str
+    counter_wallet_id: Optional[uuid.UUID]
+
+    def signed(self, amount: int) -> int:
+        return -amount if self.kind == "debit" else amount
+
+
+@dataclass
+class ChunkReport:
+    processed: int = 0
+    applied_count: int = 0
+    applied_cents: int = 0
+    skipped_count: int = 0
+    failed_count: int = 0
+    reasons: Counter = field(default_factory=Counter)
+    rows: List[tuple] = field(default_factory=list)  # (recipient id, status, reason, transfer id)
+
+    def applied(self, r: Recipient, signed: int, transfer_id: uuid.UUID) -> None:
+        self.processed += 1
+        self.applied_count += 1
+        self.applied_cents += signed
+        self.rows.append((r.id, "applied", None, transfer_id))
+
+    def skip(self, r: Recipient, reason: str, transfer_id: Optional[uuid.UUID] = None) -> None:
+        self.processed += 1
+        self.skipped_count += 1
+        self.reasons[reason] += 1
+        self.rows.append((r.id, "skipped", reason, transfer_id))
+
+    def fail(self, r: Recipient, reason: str) -> None:
+        self.processed += 1
+        self.failed_count += 1
+        self.reasons[reason] += 1
+        self.rows.append((r.id, "failed", reason[:64], None))
+
+
+def campaign_out(c: LedgerCampaign) -> dict:
+    return {
+        "id": str(c.id),
+        "name": c.name,
+        "kind": c.kind,
+        "status": c.status,
+        "amount_cents": c.amount_cents,
+        "currency_code": c.currency_code,
+        "memo": c.memo,
+        "recipient_count": c.recipient_count,
+        "processed_count": c.processed_count,
+        "pending_count": max(0, c.recipient_count - c.processed_count),
+        "applied_count": c.applied_count,
+        "applied_cents": c.applied_cents,
+        "skipped_count": c.skipped_count,
+        "failed_count": c.failed_count,
+        "chunks": c.chunks,
+        "reasons": c.reasons or {},
+        "error": c.error,
+        "worker_id": c.worker_id,
+        "heartbeat_at": c.heartbeat_at.isoformat() + "Z" if c.heartbeat_at else None,
+        "created_at": c.created_at.isoformat() + "Z",
+        "started_at": c.started_at.isoformat() + "Z" if c.started_at else None,
+        "finished_at": c.finished_at.isoformat() + "Z" if c.finished_at else None,
+    }
+
+
+def recipient_out(r: LedgerCampaignRecipient) -> dict:
+    return {
+        "id": str(r.id),
+        "user_id": str(r.user_id),
+        "amount_cents": r.amount_cents,
+        "status": r.status,
+        "reason": r.reason,
+        "transfer_id": str(r.transfer_id) if r.transfer_id else None,
+        "processed_at": r.processed_at.isoformat() + "Z" if r.processed_at else None,
+    }
+
+
+def _check_amount(kind: str, amount: Optional[int]) -> None:
+    if amount is None:
+        return
+    if (kind == "fee_adjustment" and amount == 0) or (kind != "fee_adjustment" and amount <= 0):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid amount")
+
+
+def create_campaign(
+    db: Session,
+    *,
+    name: str,
+    kind: str,
+    amount_cents: Optional[int] = None,
+    memo: Optional[str] = None,
+    currency_code: str = "SYP",
+) -> LedgerCampaign:
+    if kind not in KINDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"kind must be one of {', '.join(KINDS)}")
+    _check_amount(kind, amount_cents)
+    c = LedgerCampaign(
+        name=name.strip()[:128] or kind,
+        kind=kind,
+        status="draft",
+        amount_cents=amount_cents,
+        currency_code=currency_code,
+        memo=memo,
+        reasons={},
+    )
+    db.add(c)
+    db.flush()
+    return c
+
+
+def _require_draft(c: LedgerCampaign) -> None:
+    if c.status != "draft":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Recipients can only be added to a draft campaign")
+
+
+def _refresh_recipient_count(db: Session, c: LedgerCampaign) -> None:
+    c.recipient_count = db.scalar(
+        select(func.count()).select_from(LedgerCampaignRecipient).where(LedgerCampaignRecipient.campaign_id == c.id)
+    )
+    db.flush()
+
+
+def add_recipients(db: Session, c: LedgerCampaign, rows: Iterable[dict]) -> dict:
+    """Add ``{user_id, amount_cents?}`` rows; users already in the campaign are ignored."""
+    _require_draft(c)
+    seen: dict = {}
+    valid = invalid = 0
+    for row in rows:
+        try:
+            uid = uuid.UUID(str(row["user_id"]))
+            amount = int(row.get("amount_cents") or c.amount_cents or 0)
+            _check_amount(c.kind, amount)
+        except (KeyError, ValueError, TypeError, HTTPException):
+            invalid += 1
+            continue
+        valid += 1
+        seen.setdefault(uid, amount)
+    items = list(seen.items())
+    before = c.recipient_count or 0
+    unknown = 0
+    for i in range(0, len(items), INSERT_BATCH):
+        batch = items[i:i + INSERT_BATCH]
+        known = set(db.scalars(select(User.id).where(User.id.in_([uid for uid, _ in batch]))))
+        batch_rows = [
+            {"id": uuid.uuid4(), "campaign_id": c.id, "user_id": uid, "amount_cents": amount, "status": "pending"}
+            for uid, amount in batch
+            if uid in known
+        ]
+        unknown += len(batch) - len(batch_rows)
+        if batch_rows:
+            db.execute(pg_insert(LedgerCampaignRecipient.__table__).on_conflict_do_nothing(constraint="uq_campaign_recipient_user"), batch_rows)
+    _refresh_recipient_count(db, c)
+    added = c.recipient_count - before
+    return {"added": added, "duplicates": valid - unknown - added, "unknown_users": unknown, "invalid": invalid}
+
+
+def add_all_users(
+    db: Session,
+    c: LedgerCampaign,
+    *,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    idempotency_prefix: Optional[str] = None,
+) -> int:
+    """Add every user (oldest first, optionally a window of them) with the campaign amount, in one statement.
+
+    ``idempotency_prefix`` keys transfers by ``<prefix><user_id>`` instead of by recipient, so separate
+    campaigns sharing a prefix never apply the same user twice.
+    """
+    _require_draft(c)
+    if not c.amount_cents:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Campaign amount required")
+    key = literal(idempotency_prefix) + cast(User.id, String) if idempotency_prefix else literal(None, String)
+    src = (
+        select(
+            func.gen_random_uuid(),
+            literal(c.id, UUID(as_uuid=True)),
+            User.id,
+            literal(int(c.amount_cents), Integer),
+            key,
+            literal("pending"),
+        )
+        .order_by(User.created_at.asc(), User.id.asc())
+        .offset(max(0, offset))
+    )
+    if limit:
+        src = src.limit(limit)
+    t = LedgerCampaignRecipient.__table__
+    res = db.execute(
+        pg_insert(t)
+        .from_select(["id", "campaign_id", "user_id", "amount_cents", "idempotency_key", "status"], src)
+        .on_conflict_do_nothing(constraint="uq_campaign_recipient_user")
+    )
+    _refresh_recipient_count(db, c)
+    return res.rowcount
+
+
+def start_campaign(db: Session, c: LedgerCampaign) -> LedgerCampaign:
+    """Queue a draft campaign, or resume a paused/failed one from where it stopped."""
+    if c.status == "queued" or c.status == "running":
+        return c
+    if c.status not in STARTABLE:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Campaign is {c.status}")
+    if c.kind != "credit":
+        ensure_fee_wallet(db)  # created up front so workers only ever lock it
+    c.status = "queued"
+    c.error = None
+    db.flush()
+    record_event(db, "campaigns.queued", None, {"campaign_id": str(c.id), "kind": c.kind, "recipients": c.recipient_count})
+    return c
+
+
+def stop_campaign(db: Session, c: LedgerCampaign, new_status: str) -> LedgerCampaign:
+    """Pause or cancel; a running worker stops before committing its next chunk."""
+    if c.status in ("completed", "cancelled"):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Campaign is {c.status}")
+    c.status = new_status
+    if new_status == "cancelled":
+        c.finished_at = datetime.utcnow()
+    db.flush()
+    record_event(db, f"campaigns.{new_status}", None, {"campaign_id": str(c.id)})
+    return c
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"[-64:]
+
+
+def claim_campaign(db: Session, campaign_id, worker_id: str, stale_secs: float) -> bool:
+    """Take a queued campaign, or a running one whose worker stopped heart-beating."""
+    now = datetime.utcnow()
+    res = db.execute(
+        update(LedgerCampaign)
+        .where(
+            LedgerCampaign.id == campaign_id,
+            or_(
+                LedgerCampaign.status == "queued",
+                (LedgerCampaign.status == "running")
+                & or_(LedgerCampaign.heartbeat_at.is_(None), LedgerCampaign.heartbeat_at < now - timedelta(seconds=stale_secs)),
+            ),
+        )
+        .values(status="running", worker_id=worker_id, heartbeat_at=now, started_at=func.coalesce(LedgerCampaign.started_at, now))
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount == 1
+
+
+def load_pending(db: Session, campaign_id, after_id=None, limit: int = 1000) -> List[Recipient]:
+    q = (
+        select(
+            LedgerCampaignRecipient.id,
+            LedgerCampaignRecipient.user_id,
+            LedgerCampaignRecipient.amount_cents,
+            LedgerCampaignRecipient.idempotency_key,
+        )
+        .where(LedgerCampaignRecipient.campaign_id == campaign_id, LedgerCampaignRecipient.status == "pending")
+        .order_by(LedgerCampaignRecipient.id.asc())
+        .limit(limit)
+    )
+    if after_id is not None:
+        q = q.where(LedgerCampaignRecipient.id > after_id)
+    return [Recipient(*row) for row in db.execute(q)]
+
+
+def apply_chunk(db: Session, plan: Plan, chunk: List[Recipient]) -> ChunkReport:
+    """Apply one chunk of recipients in the current transaction (caller commits or rolls back)."""
+    rep = ChunkReport()
+    ts = datetime.utcnow()
+    pending = set(
+        db.scalars(
+            select(LedgerCampaignRecipient.id)
+            .where(LedgerCampaignRecipient.id.in_([r.id for r in chunk]), LedgerCampaignRecipient.status == "pending")
+            .with_for_update(skip_locked=True)
+        )
+    )
+    chunk = [r for r in chunk if r.id in pending]
+    if not chunk:
+        return rep
+    incoming = {r.user_id for r in chunk if plan.signed(r.amount_cents) > 0}
+    if incoming:
+        # Credited users without a wallet get one, as on first login
+        db.execute(
+            pg_insert(Wallet.__table__).on_conflict_do_nothing(index_elements=["user_id"]),
+            [{"id": uuid.uuid4(), "user_id": u, "balance_cents": 0, "currency_code": plan.currency_code, "created_at": ts} for u in incoming],
+        )
+    wallet_filter = Wallet.user_id.in_({r.user_id for r in chunk})
+    if plan.counter_wallet_id is not None:
+        wallet_filter = or_(wallet_filter, Wallet.id == plan.counter_wallet_id)
+    locked = db.execute(
+        select(Wallet.id, Wallet.user_id, Wallet.balance_cents, Wallet.currency_code).where(wallet_filter).order_by(Wallet.id).with_for_update()
+    ).all()
+    wallets = {w.user_id: w for w in locked}
+    balance = {w.id: w.balance_cents for w in locked}
+    done = dict(
+        db.execute(select(Transfer.idempotency_key, Transfer.id).where(Transfer.idempotency_key.in_([r.idem_key for r in chunk]))).all()
+    )
+
+    transfers, entries = [], []
+    delta: Counter = Counter()
+    for r in chunk:
+        if r.idem_key in done:
+            rep.skip(r, "already_applied", done[r.idem_key])
+            continue
+        w = wallets.get(r.user_id)
+        if w is None:
+            rep.fail(r, "wallet_missing")
+            continue
+        if w.currency_code != plan.currency_code:
+            rep.fail(r, "currency_mismatch")
+            continue
+        signed = plan.signed(r.amount_cents)
+        if signed == 0:
+            rep.skip(r, "zero_amount")
+            continue
+        if signed < 0 and balance[w.id] < -signed:
+            rep.fail(r, "insufficient_balance")
+            continue
+        tid = uuid.uuid4()
+        src = plan.counter_wallet_id if signed > 0 else w.id
+        dst = w.id if signed > 0 else plan.counter_wallet_id
+        transfers.append({
+            "id": tid,
+            "from_wallet_id": src,
+            "to_wallet_id": dst,
+            "amount_cents": abs(signed),
+            "currency_code": plan.currency_code,
+            "status": "completed",
+            "idempotency_key": r.idem_key,
+            "created_at": ts,
+        })
+        entries.append({"id": uuid.uuid4(), "transfer_id": tid, "wallet_id": w.id, "amount_cents_signed": signed, "created_at": ts})
+        balance[w.id] += signed
+        delta[w.id] += signed
+        if plan.counter_wallet_id is not None:
+            entries.append({"id": uuid.uuid4(), "transfer_id": tid, "wallet_id": plan.counter_wallet_id, "amount_cents_signed": -signed, "created_at": ts})
+            balance[plan.counter_wallet_id] -= signed
+            delta[plan.counter_wallet_id] -= signed
+        done[r.idem_key] = tid
+        rep.applied(r, signed, tid)
+
+    if transfers:
+        db.execute(insert(Transfer.__table__), transfers)
+        db.execute(insert(LedgerEntry.__table__), entries)
+    moved = [(wid, v) for wid, v in delta.items() if v]
+    if moved:
+        v = unnest_rows("v", moved, ("id", UUID(as_uuid=True)), ("delta", Integer))
+        db.execute(
+            update(Wallet).where(Wallet.id == v.c.id).values(balance_cents=Wallet.balance_cents + v.c.delta),
+            execution_options={"synchronize_session": False},
+        )
+    if rep.rows:
+        s = unnest_rows("s", rep.rows, ("id", UUID(as_uuid=True)), ("status", String), ("reason", String), ("tid", UUID(as_uuid=True)))
+        db.execute(
+            update(LedgerCampaignRecipient)
+            .where(LedgerCampaignRecipient.id == s.c.id)
+            .values(status=s.c.status, reason=s.c.reason, transfer_id=s.c.tid, processed_at=ts),
+            execution_options={"synchronize_session": False},
+        )
+    return rep
+
+
+def _record_chunk(db: Session, campaign_id, worker_id: str, rep: ChunkReport) -> bool:
+    """Bump campaign counters in the chunk's transaction; False if the worker no longer owns the campaign."""
+    row = db.execute(
+        select(LedgerCampaign.reasons)
+        .where(LedgerCampaign.id == campaign_id, LedgerCampaign.worker_id == worker_id, LedgerCampaign.status == "running")
+        .with_for_update()
+    ).first()
+    if row is None:
+        return False
+    reasons = Counter(row.reasons or {})
+    reasons.update(rep.reasons)
+    db.execute(
+        update(LedgerCampaign)
+        .where(LedgerCampaign.id == campaign_id)
+        .values(
+            processed_count=LedgerCampaign.processed_count + rep.processed,
+            applied_count=LedgerCampaign.applied_count + rep.applied_count,
+            applied_cents=LedgerCampaign.applied_cents + rep.applied_cents,
+            skipped_count=LedgerCampaign.skipped_count + rep.skipped_count,
+            failed_count=LedgerCampaign.failed_count + rep.failed_count,
+            chunks=LedgerCampaign.chunks + 1,
+            reasons=dict(reasons),
+            heartbeat_at=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def _apply_isolated(db: Session, plan: Plan, chunk: List[Recipient], worker_id: str) -> bool:
+    """Apply and commit a chunk; a chunk failing in the database is retried one recipient per transaction."""
+    try:
+        rep = apply_chunk(db, plan, chunk)
+        if not _record_chunk(db, plan.id, worker_id, rep):
+            db.rollback()
+            return False
+        db.commit()
+        return True
+    except Exception as e:
+        db.rollback()
+        log.warning("campaign %s chunk of %d recipients failed", plan.id, len(chunk), exc_info=True)
+        if len(chunk) > 1:
+            return all(_apply_isolated(db, plan, [r], worker_id) for r in chunk)
+        rep = ChunkReport()
+        rep.fail(chunk[0], f"error:{type(e).__name__}")
+        db.execute(
+            update(LedgerCampaignRecipient)
+            .where(LedgerCampaignRecipient.id == chunk[0].id, LedgerCampaignRecipient.status == "pending")
+            .values(status="failed", reason=rep.rows[0][2], processed_at=datetime.utcnow())
+        )
+        if not _record_chunk(db, plan.id, worker_id, rep):
+            db.rollback()
+            return False
+        db.commit()
+        return True
+
+
+def _finish(db: Session, campaign_id, worker_id: str, new_status: str, error: Optional[str] = None) -> None:
+    db.execute(
+        update(LedgerCampaign)
+        .where(LedgerCampaign.id == campaign_id, LedgerCampaign.worker_id == worker_id, LedgerCampaign.status == "running")
+        .values(status=new_status, error=error, finished_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def run_campaign(
+    campaign_id,
+    *,
+    worker_id: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    stale_secs: Optional[float] = None,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> dict:
+    """Claim and process a campaign until no recipient is pending, it is paused/cancelled, or it is taken over."""
+    campaign_id = uuid.UUID(str(campaign_id))
+    worker_id = worker_id or default_worker_id()
+    chunk_size = chunk_size or settings.LEDGER_CAMPAIGN_CHUNK_SIZE
+    stale_secs = settings.LEDGER_CAMPAIGN_STALE_SECS if stale_secs is None else stale_secs
+    db = session_factory()
+    try:
+        claimed = claim_campaign(db, campaign_id, worker_id, stale_secs)
+        db.commit()
+        if claimed:
+            c = db.get(LedgerCampaign, campaign_id)
+            counter = ensure_fee_wallet(db).id if c.kind != "credit" else None
+            plan = Plan(c.id, c.kind, c.currency_code, counter)
+            db.commit()
+            try:
+                owned, after, progressed = True, None, False
+                while owned:
+                    chunk = load_pending(db, campaign_id, after, chunk_size)
+                    if not chunk:
+                        if after is None or not progressed:
+                            break
+                        # Rows skipped as locked on this pass get one more look
+                        after, progressed = None, False
+                        continue
+                    after = chunk[-1].id
+                    owned = _apply_isolated(db, plan, chunk, worker_id)
+                    progressed = True
+                if owned:
+                    _finish(db, campaign_id, worker_id, "completed")
+                    db.commit()
+                    record_event(db, "campaigns.completed", None, {"campaign_id": str(campaign_id)})
+                    db.commit()
+            except Exception as e:
+                db.rollback()
+                log.exception("campaign %s stopped", campaign_id)
+                _finish(db, campaign_id, worker_id, "failed", f"{type(e).__name__}: {e}"[:512])
+                db.commit()
+                raise
+        db.expire_all()
+        out = campaign_out(db.get(LedgerCampaign, campaign_id))
+        out["claimed"] = claimed
+        return out
+    finally:
+        db.close()
+
+
+def run_queued_campaigns(where=None, *, limit: int = 5) -> List[dict]:
+    """Run queued campaigns and take over ones whose worker died (used by the scheduler job)."""
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.LEDGER_CAMPAIGN_STALE_SECS)
+    db = SessionLocal()
+    try:
+        q = (
+            select(LedgerCampaign.id)
+            .where(
+                or_(
+                    LedgerCampaign.status == "queued",
+                    (LedgerCampaign.status == "running") & (LedgerCampaign.heartbeat_at < stale_before),
+                )
+            )
+            .order_by(LedgerCampaign.created_at.asc())
+            .limit(limit)
+        )
+        if where is not None:
+            q = q.where(where)
+        ids = list(db.scalars(q))
+    finally:
+        db.close()
+    return [run_campaign(cid) for cid in ids]
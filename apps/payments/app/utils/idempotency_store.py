@@ -1,13 +1,20 @@
 import hashlib
 import json
-from datetime import datetime
-from typing import Any, Tuple
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Mapping, Optional, Tuple
 
 from fastapi import HTTPException, status
+from sqlalchemy import delete, select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
+from superapp_shared.idempotency import IdempotencyStore, default_credential, idempotency_store_from_env, run_gc
+
+from ..config import settings
+from ..database import engine
 from ..models import IdempotencyKey
+from .hmacsig import verify_hmac_and_prevent_replay
 
 
 def body_sha256(payload: Any) -> str:
@@ -86,3 +93,49 @@ def finalize(db: Session, rec: IdempotencyKey, result_ref: str | None) -> None:
     rec.updated_at = datetime.utcnow()
     db.flush()
 
+
+
+# Response replay layer (superapp_shared.idempotency) in front of the handlers above
+
+_response_store: Optional[IdempotencyStore] = None
+_store_lock = threading.Lock()
+
+
+def response_store() -> IdempotencyStore:
+    global _response_store
+    if _response_store is None:
+        with _store_lock:
+            if _response_store is None:
+                _response_store = idempotency_store_from_env(engine, settings.REDIS_URL, prefix="idem:payments")
+    return _response_store
+
+
+def request_credential(headers: Mapping[str, str], body: bytes) -> Optional[str]:
+    """Scope for stored responses: the bearer token / shared secret, or a valid internal HMAC.
+
+    HMAC retries are re-signed with a fresh timestamp, so signed calls share one scope; the
+    signature is checked without replay marking (the handler still does its own check).
+    """
+    cred = default_credential(headers, body)
+    if cred or not settings.INTERNAL_API_SECRET:
+        return cred
+    sign, ts = headers.get("x-internal-sign"), headers.get("x-internal-ts")
+    if not sign or not ts:
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    if isinstance(payload, dict) and verify_hmac_and_prevent_replay(ts, payload, sign, ttl_override=0):
+        return "internal-hmac"
+    return None
+
+
+def gc_expired(limit: int = 10_000) -> dict:
+    """Drop expired stored responses and ``idempotency_keys`` rows older than IDEMPOTENCY_TTL_SECS."""
+    responses = run_gc(response_store(), "payments", limit)
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.IDEMPOTENCY_TTL_SECS)
+    with engine.begin() as conn:
+        ids = select(IdempotencyKey.id).where(IdempotencyKey.created_at < cutoff).limit(limit).scalar_subquery()
+        keys = conn.execute(delete(IdempotencyKey).where(IdempotencyKey.id.in_(ids))).rowcount
+    return {"responses": responses, "keys": int(keys or 0)}
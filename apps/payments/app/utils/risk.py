@@ -1,11 +1,25 @@
 from __future__ import annotations
 import os
+import threading
+import uuid
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Iterable, List, Optional
+from sqlalchemy import event, insert, select
 from sqlalchemy.orm import Session
-from ..models import User, Merchant
+from ..config import settings
+from ..database import SessionLocal, engine as db_engine
+from ..models import User, Merchant, RiskDecision, RiskRuleSet, Transfer, Wallet
 from ..utils.audit import record_event
 from fastapi import HTTPException, status
+from superapp_shared.risk import (
+    DecisionRecorder,
+    RiskEngine,
+    RiskEvent,
+    RuleRegistry,
+    current_device,
+    feature_store_from_env,
+    mode_from_env,
+)
 
 
 def _getint(name: str, default: int) -> int:
@@ -15,61 +29,181 @@ def _getint(name: str, default: int) -> int:
         return default
 
 
-def evaluate_risk_and_maybe_block(
-    db: Session,
-    user: User,
-    amount_cents: int,
-    context: str,
-    merchant_user_id: Optional[str] = None,
-):
-    if os.getenv("FRAUD_RISK_ENABLED", "false").lower() != "true":
-        return
-    score = 0
-    factors: list[str] = []
+def _enabled() -> bool:
+    return os.getenv("FRAUD_RISK_ENABLED", "false").lower() == "true"
+
+
+def default_rules() -> dict:
+    """Built-in rule set: the original fixed heuristics, thresholds from FRAUD_* env."""
+    high_amt = _getint("FRAUD_HIGH_AMOUNT_CENTS", 2_000_000)  # 20,000.00 SYP
+    return {
+        "version": f"builtin-{high_amt}-{_getint('FRAUD_FLAG_SCORE', 60)}-{_getint('FRAUD_BLOCK_SCORE', 100)}",
+        "thresholds": {"flag": _getint("FRAUD_FLAG_SCORE", 60), "block": _getint("FRAUD_BLOCK_SCORE", 100)},
+        "rules": [
+            {"id": "new_account", "when": "account_age_days < 1", "score": 30},
+            {"id": "young_account", "when": "1 <= account_age_days < 7", "score": 10},
+            {"id": "kyc_l0", "when": "kyc_level <= 0", "score": 20},
+            {"id": "kyc_l1", "when": "kyc_level == 1", "score": 5},
+            {"id": "high_amount", "when": f"amount_cents >= {high_amt}", "score": 25},
+            {"id": "night", "when": "hour_utc < 6", "score": 10},
+            {"id": "new_merchant", "when": "has_merchant and merchant_age_days < 7", "score": 10},
+        ],
+    }
+
+
+def _with_version(row: RiskRuleSet) -> dict:
+    return {**(row.body or {}), "version": row.version}
 
-    # Account age
-    age_days = (datetime.utcnow() - (user.created_at or datetime.utcnow())).days
-    if age_days < 1:
-        score += 30; factors.append("new_account")
-    elif age_days < 7:
-        score += 10; factors.append("young_account")
 
-    # KYC level
+def load_rules() -> dict:
+    """Active + shadow rule sets from ``risk_rule_sets``; the built-in rules when none is active."""
+    db = SessionLocal()
     try:
-        kyc = int(getattr(user, "kyc_level", 0) or 0)
-    except Exception:
-        kyc = 0
-    if kyc <= 0:
-        score += 20; factors.append("kyc_l0")
-    elif kyc == 1:
-        score += 5; factors.append("kyc_l1")
+        rows = db.scalars(
+            select(RiskRuleSet).where(RiskRuleSet.status.in_(["active", "shadow"])).order_by(RiskRuleSet.created_at)
+        ).all()
+    finally:
+        db.close()
+    active = [r for r in rows if r.status == "active"]
+    return {
+        "active": _with_version(active[-1]) if active else default_rules(),
+        "shadow": [_with_version(r) for r in rows if r.status == "shadow"],
+    }
 
-    # Amount
-    high_amt = _getint("FRAUD_HIGH_AMOUNT_CENTS", 2_000_000)  # 20,000.00 SYP
-    if amount_cents >= high_amt:
-        score += 25; factors.append("high_amount")
 
-    # Night time (UTC)
-    hour = datetime.utcnow().hour
-    if hour < 6:
-        score += 10; factors.append("night")
+def _write_decisions(items: List[dict]) -> None:
+    rows = []
+    for d in items:
+        try:
+            uid = uuid.UUID(d["subject"]) if d.get("subject") else None
+        except ValueError:
+            uid = None
+        rows.append({
+            "id": uuid.uuid4(),
+            "context": d["context"][:32],
+            "user_id": uid,
+            "amount_cents": d.get("amount_cents") or 0,
+            "action": d["action"],
+            "score": int(round(d["score"])),
+            "enforced": d["enforced"],
+            "version": str(d["version"])[:64],
+            "hits": d["hits"],
+            "features": d["features"],
+            "shadow": d["shadow"] or None,
+            "created_at": datetime.utcfromtimestamp(d["ts"]),
+        })
+    with db_engine.begin() as conn:
+        conn.execute(insert(RiskDecision.__table__), rows)
+
+
+_engine: Optional[RiskEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> RiskEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RiskEngine(
+                    "payments",
+                    RuleRegistry(load_rules, fallback=default_rules(), reload_secs=_getint("RISK_RULES_RELOAD_SECS", 10)),
+                    feature_store_from_env(settings.REDIS_URL, prefix="risk:payments"),
+                    mode=mode_from_env(),
+                    recorder=DecisionRecorder(_write_decisions),
+                )
+    return _engine
+
 
-    # New merchant (if receiving)
+def _facts(db: Session, user: User, merchant_user_id: Optional[str]) -> dict:
+    now = datetime.utcnow()
+    facts = {
+        "account_age_days": (now - (user.created_at or now)).days,
+        "kyc_level": int(getattr(user, "kyc_level", 0) or 0),
+        "hour_utc": now.hour,
+        "has_merchant": False,
+    }
     if merchant_user_id is not None:
         m_user = db.get(User, merchant_user_id)
         if m_user and getattr(m_user, "is_merchant", False):
             merchant = db.query(Merchant).filter(Merchant.user_id == m_user.id).one_or_none()
-            if merchant and (datetime.utcnow() - merchant.created_at) < timedelta(days=7):
-                score += 10; factors.append("new_merchant")
+            if merchant:
+                facts["has_merchant"] = True
+                facts["merchant_age_days"] = (now - merchant.created_at) / timedelta(days=1)
+    return facts
 
-    flag_thr = _getint("FRAUD_FLAG_SCORE", 60)
-    block_thr = _getint("FRAUD_BLOCK_SCORE", 100)
 
-    data = {"context": context, "amount_cents": amount_cents, "score": score, "factors": factors}
-    if score >= block_thr:
+def evaluate_risk_and_maybe_block(
+    db: Session,
+    user: User,
+    amount_cents: int,
+    context: str,
+    merchant_user_id: Optional[str] = None,
+    counterparty_user_id: Optional[str] = None,
+):
+    if not _enabled():
+        return
+    d = get_engine().evaluate(
+        context,
+        user_id=str(user.id),
+        amount_cents=amount_cents,
+        counterparty=merchant_user_id or counterparty_user_id,
+        facts=_facts(db, user, merchant_user_id),
+    )
+    data = {
+        "context": context,
+        "amount_cents": amount_cents,
+        "score": d.score,
+        "factors": [h.rule for h in d.hits],
+        "version": d.version,
+    }
+    if d.blocked:
         record_event(db, "fraud.block", str(user.id), data)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="risk_blocked")
-    if score >= flag_thr:
+    if d.flagged:
         record_event(db, "fraud.flag", str(user.id), data)
-    return
+    return d
+
+
+def observe_ledger(events: Iterable[RiskEvent]) -> None:
+    """Feed committed money movements written outside the ORM (bulk billing) into the feature store."""
+    if not _enabled():
+        return
+    eng = get_engine()
+    for ev in events:
+        eng.observe(ev)
+
+
+# Transfers written through ORM sessions are observed once their transaction commits:
+# after_flush resolves wallets to users, after_commit folds the events into the store.
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_transfers(session, flush_context):
+    if not _enabled():
+        return
+    new = [o for o in session.new if isinstance(o, Transfer) and o.status == "completed"]
+    if not new:
+        return
+    wallet_ids = {t.to_wallet_id for t in new} | {t.from_wallet_id for t in new if t.from_wallet_id}
+    owners = dict(session.connection().execute(select(Wallet.id, Wallet.user_id).where(Wallet.id.in_(wallet_ids))).all())
+    device = current_device()
+    pending = session.info.setdefault("risk_events", [])
+    for t in new:
+        to_user = owners.get(t.to_wallet_id)
+        if t.from_wallet_id is None:
+            pending.append(RiskEvent("topup", str(to_user) if to_user else None, t.amount_cents, device=device))
+        else:
+            from_user = owners.get(t.from_wallet_id)
+            pending.append(RiskEvent("send", str(from_user) if from_user else None, t.amount_cents, str(to_user) if to_user else None, device))
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _observe_transfers(session):
+    events = session.info.pop("risk_events", None)
+    if events:
+        observe_ledger(events)
+
 
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_transfers(session):
+    session.info.pop("risk_events", None)
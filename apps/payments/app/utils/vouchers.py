@@ -0,0 +1,340 @@
+"""Voucher codes, issuance, single-use redemption and summary counters.
+
+Codes look like ``[prefix]XXXX-XXXX-XXXX-XXXX``: 15 random Crockford base32
+symbols (75 bits) plus one Luhn mod 32 check symbol, so a mistyped or
+swapped symbol is rejected without a database lookup. Input is matched case
+insensitively and O/I/L read as 0/1. Codes minted before this format (hex,
+no dashes) are looked up as typed.
+
+- Issuance inserts ``INSERT_BATCH`` rows per statement (ids and codes bound
+  as two arrays) with ``ON CONFLICT (code) DO NOTHING RETURNING`` and re-draws
+  whatever collided, so a batch of any size never fails on a duplicate code.
+- Redemption is one conditional ``UPDATE ... WHERE status = 'active'
+  RETURNING``; concurrent attempts on a code queue on its row and exactly one
+  finds it active. The wallet credit runs in the same transaction, so a
+  failed credit leaves the voucher active.
+- ``voucher_stats`` keeps count/amount per (creator, status), updated in the
+  transaction that changes the vouchers and spread over
+  ``VOUCHER_STATS_SHARDS`` rows per key; the admin summary sums those rows
+  instead of scanning vouchers. ``rebuild_voucher_stats`` recomputes them.
+- ``export_csv`` streams rows from a server-side cursor, creator/redeemer
+  phones joined in, without holding the result in memory.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import random
+import re
+import secrets
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import String, delete, func, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy.orm import Session, aliased
+
+from superapp_shared.bulk import unnest_rows
+
+from ..auth import ensure_user_and_wallet
+from ..config import settings
+from ..database import SessionLocal
+from ..models import LedgerEntry, TopupVoucher, Transfer, User, VoucherStat, Wallet
+
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # Crockford base32
+BODY_LEN = 15
+INSERT_BATCH = 5000
+EXPORT_CHUNK = 1000
+STATUSES = ("active", "redeemed", "revoked")
+PREFIX_RE = re.compile(r"[A-Za-z0-9_-]{1,10}")
+
+_INDEX = {c: i for i, c in enumerate(ALPHABET)}
+_TAIL = re.compile(r"([0-9A-Za-z]{4})-([0-9A-Za-z]{4})-([0-9A-Za-z]{4})-([0-9A-Za-z]{4})$")
+_READ_AS = str.maketrans({"O": "0", "I": "1", "L": "1"})
+
+voucher_stats: Counter = Counter()
+
+
+def check_symbol(body: str) -> str:
+    """Luhn mod 32 check symbol over ``body`` (Crockford symbols)."""
+    n = len(ALPHABET)
+    total, factor = 0, 2
+    for ch in reversed(body):
+        addend = factor * _INDEX[ch]
+        total += addend // n + addend % n
+        factor = 3 - factor
+    return ALPHABET[(n - total % n) % n]
+
+
+def _group(symbols: str) -> str:
+    return "-".join(symbols[i:i + 4] for i in range(0, len(symbols), 4))
+
+
+def generate_code(prefix: str = "") -> str:
+    bits = secrets.randbits(5 * BODY_LEN)
+    body = "".join(ALPHABET[(bits >> (5 * i)) & 31] for i in range(BODY_LEN))
+    return prefix + _group(body + check_symbol(body))
+
+
+def normalize_code(raw: str) -> Optional[str]:
+    """Canonical form of a typed code, or None when its check symbol is wrong."""
+    raw = (raw or "").strip()
+    m = _TAIL.search(raw)
+    if m is None:
+        return raw  # pre-check-digit code: match as typed
+    symbols = "".join(m.groups()).upper().translate(_READ_AS)
+    if any(ch not in _INDEX for ch in symbols) or check_symbol(symbols[:-1]) != symbols[-1]:
+        return None
+    return raw[: m.start()] + _group(symbols)
+
+
+def validate_prefix(prefix: Optional[str]) -> str:
+    prefix = (prefix or "").strip()
+    if prefix and not PREFIX_RE.fullmatch(prefix):
+        raise HTTPException(status_code=400, detail="Invalid prefix")
+    return prefix
+
+
+# -- summary counters -----------------------------------------------------------
+
+
+def _bump(db: Session, deltas: Sequence[Tuple[uuid.UUID, str, int, int]]) -> None:
+    """Add (creator, status, count, amount_cents) deltas to ``voucher_stats``.
+
+    Rows are upserted in (creator, status) order on one random shard, so two
+    transactions never take the same counter rows in opposite order.
+    """
+    if not deltas:
+        return
+    shard = random.randrange(max(1, int(settings.VOUCHER_STATS_SHARDS)))
+    merged: dict = {}
+    for creator, st, n, cents in deltas:
+        c, a = merged.get((creator, st), (0, 0))
+        merged[(creator, st)] = (c + n, a + cents)
+    rows = [
+        {"created_by_user_id": creator, "status": st, "shard": shard, "count": n, "amount_cents": cents}
+        for (creator, st), (n, cents) in sorted(merged.items(), key=lambda kv: (str(kv[0][0]), kv[0][1]))
+    ]
+    stmt = pg_insert(VoucherStat.__table__).values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["created_by_user_id", "status", "shard"],
+        set_={
+            "count": VoucherStat.__table__.c.count + stmt.excluded.count,
+            "amount_cents": VoucherStat.__table__.c.amount_cents + stmt.excluded.amount_cents,
+        },
+    ))
+
+
+def voucher_summary(db: Session, created_by: Optional[uuid.UUID] = None) -> dict:
+    """``{status: (count, amount_cents)}`` from the counters."""
+    q = select(VoucherStat.status, func.sum(VoucherStat.count), func.sum(VoucherStat.amount_cents)).group_by(VoucherStat.status)
+    if created_by is not None:
+        q = q.where(VoucherStat.created_by_user_id == created_by)
+    out = {st: (0, 0) for st in STATUSES}
+    for st, n, cents in db.execute(q):
+        out[st] = (int(n or 0), int(cents or 0))
+    return out
+
+
+def rebuild_voucher_stats(db: Session) -> int:
+    """Recompute ``voucher_stats`` from ``topup_vouchers`` (one shard per key); returns rows written."""
+    db.execute(delete(VoucherStat))
+    src = select(
+        TopupVoucher.created_by_user_id, TopupVoucher.status, literal(0), func.count(), func.coalesce(func.sum(TopupVoucher.amount_cents), 0)
+    ).group_by(TopupVoucher.created_by_user_id, TopupVoucher.status)
+    res = db.execute(insert(VoucherStat).from_select(["created_by_user_id", "status", "shard", "count", "amount_cents"], src))
+    return int(res.rowcount or 0)
+
+
+# -- issuance -------------------------------------------------------------------
+
+
+@dataclass
+class IssuedBatch:
+    batch_id: uuid.UUID
+    count: int
+    collisions: int = 0
+
+
+def issue_vouchers(
+    db: Session,
+    *,
+    count: int,
+    amount_cents: int,
+    created_by_user_id: uuid.UUID,
+    currency_code: str = "SYP",
+    prefix: str = "",
+    batch_id: Optional[uuid.UUID] = None,
+) -> IssuedBatch:
+    """Insert ``count`` new active vouchers under one batch id (no commit)."""
+    if count <= 0 or amount_cents <= 0:
+        raise ValueError("count and amount_cents must be positive")
+    table = TopupVoucher.__table__
+    batch = IssuedBatch(batch_id=batch_id or uuid.uuid4(), count=0)
+    now = datetime.utcnow()
+    rounds = 0
+    while batch.count < count:
+        rounds += 1
+        if rounds > 10 + count // INSERT_BATCH:
+            raise RuntimeError("could not draw unique voucher codes")
+        want = min(INSERT_BATCH, count - batch.count)
+        ids = [uuid.uuid4() for _ in range(want)]
+        codes = [generate_code(prefix) for _ in range(want)]
+        src = unnest_rows("v", list(zip(ids, codes)), ("id", UUID(as_uuid=True)), ("code", String))
+        stmt = pg_insert(table).from_select(
+            ["id", "code", "amount_cents", "currency_code", "status", "created_by_user_id", "created_at", "batch_id"],
+            select(
+                src.c.id, src.c.code, literal(amount_cents), literal(currency_code), literal("active"),
+                literal(created_by_user_id, UUID(as_uuid=True)), literal(now), literal(batch.batch_id, UUID(as_uuid=True)),
+            ),
+        )
+        inserted = len(db.execute(stmt.on_conflict_do_nothing(index_elements=["code"]).returning(table.c.id)).all())
+        batch.count += inserted
+        batch.collisions += want - inserted
+    _bump(db, [(created_by_user_id, "active", batch.count, batch.count * amount_cents)])
+    voucher_stats["issued"] += batch.count
+    voucher_stats["collisions"] += batch.collisions
+    return batch
+
+
+# -- redemption / revocation ------------------------------------------------------
+
+
+def _transition(db: Session, code: str, to_status: str, **values) -> Optional[TopupVoucher]:
+    """Move an active voucher to ``to_status`` with one conditional UPDATE; None if it was not active."""
+    return db.scalars(
+        update(TopupVoucher)
+        .where(TopupVoucher.code == code, TopupVoucher.status == "active", TopupVoucher.amount_cents > 0)
+        .values(status=to_status, **values)
+        .returning(TopupVoucher)
+        .execution_options(synchronize_session=False)
+    ).one_or_none()
+
+
+def _not_transitioned(db: Session, code: Optional[str], inactive_detail: str) -> HTTPException:
+    row = db.execute(select(TopupVoucher.status, TopupVoucher.amount_cents).where(TopupVoucher.code == code)).first() if code is not None else None
+    if row is None:
+        voucher_stats["not_found"] += 1
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voucher not found")
+    if row.status == "active" and row.amount_cents <= 0:
+        return HTTPException(status_code=400, detail="Invalid voucher amount")
+    voucher_stats["rejected_inactive"] += 1
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=inactive_detail)
+
+
+def _mint(db: Session, wallet: Wallet, amount: int, key: str) -> None:
+    t = Transfer(
+        from_wallet_id=None,
+        to_wallet_id=wallet.id,
+        amount_cents=amount,
+        currency_code=wallet.currency_code,
+        status="completed",
+        idempotency_key=key,
+    )
+    db.add(t)
+    db.flush()
+    db.add(LedgerEntry(transfer_id=t.id, wallet_id=wallet.id, amount_cents_signed=amount))
+    wallet.balance_cents = wallet.balance_cents + amount
+
+
+def redeem_voucher(db: Session, code: str, user: User) -> TopupVoucher:
+    """Redeem ``code`` into the user's wallet, net of ``VOUCHER_FEE_BPS`` (no commit).
+
+    Raises 404 for unknown or mistyped codes and 400 once the voucher is no
+    longer active; the caller's transaction rollback undoes a partial credit.
+    """
+    norm = normalize_code(code)
+    if norm is None:
+        voucher_stats["bad_check"] += 1
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voucher not found")
+    v = _transition(db, norm, "redeemed", redeemed_by_user_id=user.id, redeemed_at=datetime.utcnow())
+    if v is None:
+        raise _not_transitioned(db, norm, "Voucher not active")
+
+    total = int(v.amount_cents)
+    bps = max(0, int(getattr(settings, "VOUCHER_FEE_BPS", 100)))
+    fee = min(max(0, int((total * bps + 5000) // 10000)), total)
+    net = total - fee
+
+    w = db.query(Wallet).filter(Wallet.user_id == user.id).with_for_update().one()
+    _mint(db, w, net, f"voucher:{v.code}:net")
+    if fee > 0:
+        fee_user = ensure_user_and_wallet(db, settings.FEE_WALLET_PHONE, name="Platform Fee")
+        fee_wallet = db.query(Wallet).filter(Wallet.user_id == fee_user.id).with_for_update().one()
+        _mint(db, fee_wallet, fee, f"voucher:{v.code}:fee")
+
+    _bump(db, [(v.created_by_user_id, "active", -1, -total), (v.created_by_user_id, "redeemed", 1, total)])
+    db.flush()
+    voucher_stats["redeemed"] += 1
+    return v
+
+
+def revoke_voucher(db: Session, code: str) -> TopupVoucher:
+    norm = normalize_code(code)
+    v = _transition(db, norm, "revoked") if norm is not None else None
+    if v is None:
+        raise _not_transitioned(db, norm, "Cannot revoke non-active voucher")
+    _bump(db, [(v.created_by_user_id, "active", -1, -int(v.amount_cents)), (v.created_by_user_id, "revoked", 1, int(v.amount_cents))])
+    voucher_stats["revoked"] += 1
+    return v
+
+
+# -- export ---------------------------------------------------------------------
+
+EXPORT_HEADER = ["code", "amount_syp", "status", "created_at", "redeemed_at", "created_by_phone", "redeemed_by_phone", "qr_text"]
+
+
+def _iso(dt: Optional[datetime]) -> str:
+    return (dt.isoformat() + "Z") if dt else ""
+
+
+def export_csv(
+    *,
+    status_filter: Optional[str] = None,
+    prefix: Optional[str] = None,
+    created_by: Optional[uuid.UUID] = None,
+    batch_id: Optional[uuid.UUID] = None,
+) -> Iterator[str]:
+    """Yield CSV text in chunks of ``EXPORT_CHUNK`` vouchers, newest first.
+
+    Runs on its own session so the response can outlive the request's one.
+    """
+    creator, redeemer = aliased(User), aliased(User)
+    q = (
+        select(TopupVoucher.code, TopupVoucher.amount_cents, TopupVoucher.status, TopupVoucher.created_at, TopupVoucher.redeemed_at,
+               creator.phone, redeemer.phone)
+        .outerjoin(creator, creator.id == TopupVoucher.created_by_user_id)
+        .outerjoin(redeemer, redeemer.id == TopupVoucher.redeemed_by_user_id)
+        .order_by(TopupVoucher.created_at.desc(), TopupVoucher.id)
+    )
+    if status_filter in STATUSES:
+        q = q.where(TopupVoucher.status == status_filter)
+    if prefix:
+        q = q.where(TopupVoucher.code.like(f"{prefix}%"))
+    if created_by is not None:
+        q = q.where(TopupVoucher.created_by_user_id == created_by)
+    if batch_id is not None:
+        q = q.where(TopupVoucher.batch_id == batch_id)
+
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(EXPORT_HEADER)
+    db = SessionLocal()
+    try:
+        result = db.execute(q.execution_options(stream_results=True, yield_per=EXPORT_CHUNK))
+        for part in result.partitions():
+            for code, cents, st, created_at, redeemed_at, creator_phone, redeemer_phone in part:
+                w.writerow([code, int(cents // 100), st, _iso(created_at), _iso(redeemed_at), creator_phone or "", redeemer_phone or "", f"VCHR|{code}"])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        db.close()
+
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the invoice autopay billing run (app.utils.billing).
+
+Usage:
+  DB_URL=postgresql+psycopg2://... python apps/payments/scripts/bench_invoice_autopay.py \
+      [--invoices 100000] [--payers 20000] [--merchants 50] [--chunk 500] [--legacy 500]
+
+Seeds ``--invoices`` due invoices spread over ``--payers`` payers (with
+autopay mandates and funded wallets, ~5% of payers short on balance) and
+``--merchants`` issuers, all tagged with a per-run phone prefix, then runs
+one billing run scoped to those payers. Reports invoices/s, SQL statements
+and commits per invoice, and checks that wallet balances still match their
+ledger entries. ``--legacy N`` first runs the previous per-invoice sweep
+(mandate lookup + ``pay_invoice`` per row) on N extra invoices for
+comparison. Seeded rows are left in place; use a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, insert, select
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs", "superapp_shared"))
+os.environ.setdefault("EVENT_SINK", "none")
+
+if not os.getenv("DB_URL"):
+    print("Set DB_URL env to point to a scratch payments database", file=sys.stderr)
+    sys.exit(2)
+
+from app.database import SessionLocal, engine  # type: ignore  # noqa: E402
+from app.models import Base, EBillMandate, Invoice, LedgerEntry, User, Wallet  # type: ignore  # noqa: E402
+from app.utils.billing import run_invoice_autopay  # type: ignore  # noqa: E402
+
+
+class StatementCounter:
+    def __init__(self) -> None:
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine, "before_cursor_execute", self._stmt)
+        event.listen(engine, "commit", self._commit)
+
+    def _stmt(self, *a, **kw) -> None:
+        self.statements += 1
+
+    def _commit(self, *a, **kw) -> None:
+        self.commits += 1
+
+    def reset(self) -> None:
+        self.statements = self.commits = 0
+
+
+def _seed(tag: str, invoices: int, payers: int, merchants: int, rnd: random.Random) -> list:
+    now = datetime.utcnow()
+    users, wallets, mandates, invs = [], [], [], []
+    merchant_ids = []
+    for i in range(merchants):
+        uid = uuid.uuid4()
+        merchant_ids.append(uid)
+        users.append({"id": uid, "phone": f"+{tag}9{i:06d}", "is_merchant": True, "kyc_level": 1, "created_at": now - timedelta(days=30)})
+        wallets.append({"id": uuid.uuid4(), "user_id": uid, "balance_cents": 0, "currency_code": "SYP", "created_at": now})
+    payer_ids = []
+    for i in range(payers):
+        uid = uuid.uuid4()
+        payer_ids.append(uid)
+        short = rnd.random() < 0.05
+        users.append({"id": uid, "phone": f"+{tag}1{i:06d}", "is_merchant": False, "kyc_level": 1, "created_at": now - timedelta(days=30)})
+        wallets.append({"id": uuid.uuid4(), "user_id": uid, "balance_cents": 1500 if short else 10_000_000, "currency_code": "SYP", "created_at": now})
+    issuers_of = {}
+    for uid in payer_ids:
+        issuers_of[uid] = rnd.sample(merchant_ids, min(2, merchants))
+        for mid in issuers_of[uid]:
+            mandates.append({
+                "id": uuid.uuid4(), "payer_user_id": uid, "issuer_user_id": mid, "autopay": True,
+                "max_amount_cents": 9000, "status": "active", "created_at": now, "updated_at": now,
+            })
+    for _ in range(invoices):
+        uid = rnd.choice(payer_ids)
+        invs.append({
+            "id": uuid.uuid4(), "issuer_user_id": rnd.choice(issuers_of[uid]), "payer_user_id": uid,
+            "amount_cents": rnd.randint(500, 10000), "currency_code": "SYP", "status": "pending",
+            "due_at": now - timedelta(minutes=rnd.randint(1, 600)), "created_at": now, "updated_at": now,
+        })
+    with engine.begin() as conn:
+        for model, rows in ((User, users), (Wallet, wallets), (EBillMandate, mandates), (Invoice, invs)):
+            for i in range(0, len(rows), 5000):
+                conn.execute(insert(model.__table__), rows[i:i + 5000])
+    return payer_ids
+
+
+def _legacy_sweep(scope) -> int:
+    """The sweep as it was before billing runs: mandate lookup + pay_invoice per invoice."""
+    from app.routers.invoices import pay_invoice  # type: ignore
+
+    db = SessionLocal()
+    processed = 0
+    try:
+        due = db.query(Invoice).filter(Invoice.status == "pending", Invoice.due_at <= datetime.utcnow(), scope).all()
+        for inv in due:
+            m = (
+                db.query(EBillMandate)
+                .filter(
+                    EBillMandate.payer_user_id == inv.payer_user_id,
+                    EBillMandate.issuer_user_id == inv.issuer_user_id,
+                    EBillMandate.status == "active",
+                )
+                .one_or_none()
+            )
+            if not m or not m.autopay or (m.max_amount_cents is not None and inv.amount_cents > m.max_amount_cents):
+                continue
+            try:
+                pay_invoice(str(inv.id), user=db.get(User, inv.payer_user_id), db=db, idem_key=f"auto-invoice-{inv.id}")
+                processed += 1
+            except Exception:
+                db.rollback()
+        db.commit()
+    finally:
+        db.close()
+    return processed
+
+
+def _ledger_mismatches(payer_ids) -> int:
+    db = SessionLocal()
+    try:
+        sums = (
+            select(LedgerEntry.wallet_id, func.sum(LedgerEntry.amount_cents_signed).label("s"))
+            .group_by(LedgerEntry.wallet_id)
+            .subquery()
+        )
+        rows = db.execute(
+            select(Wallet.id, Wallet.balance_cents, func.coalesce(sums.c.s, 0))
+            .outerjoin(sums, sums.c.wallet_id == Wallet.id)
+            .where(Wallet.user_id.in_(payer_ids[:2000]))
+        ).all()
+        # Seeded balances have no ledger entries; compare deltas against the seed amounts
+        return sum(1 for _, bal, s in rows if bal - s not in (1500, 10_000_000))
+    finally:
+        db.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--invoices", type=int, default=100_000)
+    ap.add_argument("--payers", type=int, default=20_000)
+    ap.add_argument("--merchants", type=int, default=50)
+    ap.add_argument("--chunk", type=int, default=500)
+    ap.add_argument("--legacy", type=int, default=0, help="also run the old per-invoice sweep on N invoices")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random(args.seed)
+    counter = StatementCounter()
+
+    if args.legacy:
+        tag = f"8{uuid.uuid4().int % 10**4:04d}"
+        payer_ids = _seed(tag, args.legacy, max(1, args.legacy // 5), args.merchants, rnd)
+        counter.reset()
+        t0 = time.perf_counter()
+        n = _legacy_sweep(Invoice.payer_user_id.in_(payer_ids))
+        dt = time.perf_counter() - t0
+        print(f"legacy  : {n:,} paid of {args.legacy:,} in {dt:.2f}s -> {args.legacy / dt:,.0f} invoices/s, "
+              f"{counter.statements / args.legacy:.2f} statements/invoice, {counter.commits} commits")
+
+    tag = f"7{uuid.uuid4().int % 10**4:04d}"
+    t0 = time.perf_counter()
+    payer_ids = _seed(tag, args.invoices, args.payers, args.merchants, rnd)
+    print(f"seeded {args.invoices:,} due invoices for {args.payers:,} payers in {time.perf_counter() - t0:.1f}s")
+
+    counter.reset()
+    t0 = time.perf_counter()
+    out = run_invoice_autopay(where=Invoice.payer_user_id.in_(payer_ids), limit=args.invoices, chunk_size=args.chunk)
+    dt = time.perf_counter() - t0
+    print(f"billing : {out['paid_count']:,} paid / {out['scanned']:,} scanned in {dt:.2f}s -> {out['scanned'] / dt:,.0f} invoices/s")
+    print(f"          {counter.statements / max(1, out['scanned']):.3f} statements/invoice, {counter.commits} commits, {out['chunks']} chunks")
+    print(f"          paid_cents={out['paid_cents']:,} failed={out['failed_count']:,} skipped={out['skipped_count']:,} reasons={out['reasons']}")
+    print(f"          wallet/ledger mismatches (sample): {_ledger_mismatches(payer_ids)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Replay recorded transactions through candidate risk rule sets.
+
+Usage:
+  python apps/payments/scripts/risk_replay.py --rules candidate.json [--rules other.json] \
+      (--events events.jsonl | --db [--since 2025-10-01] [--limit 200000] | --synthetic 100000)
+
+Every event is scored by each rule set against the rolling features built
+from the events before it (superapp_shared.risk.replay), so candidates see
+identical histories. The first rule set is the baseline: the built-in
+payments rules (``--baseline builtin``, thresholds from FRAUD_* env), the
+active rules in the database (``--baseline db``) or the first ``--rules``
+file (``--baseline none``). Prints a JSON report with per-rule-set action
+counts, decisions/sec and disagreements with the baseline.
+
+Event lines (``--events``) look like
+  {"ts": 1730500000, "kind": "send", "user_id": "...", "amount_cents": 5000,
+   "counterparty": "...", "device": "...", "context": "p2p_transfer", "facts": {"kyc_level": 1}}
+``--db`` reads completed transfers (oldest first) and uses the sender's KYC
+level and account age at the time of the transfer as facts.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs", "superapp_shared"))
+
+from superapp_shared.risk import RuleSet, replay  # noqa: E402
+
+
+def _jsonl(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _db_events(since: str | None, limit: int):
+    from sqlalchemy import and_, select
+    from sqlalchemy.orm import aliased
+
+    from app.database import SessionLocal  # type: ignore
+    from app.models import Transfer, User, Wallet  # type: ignore
+
+    src, dst = aliased(Wallet), aliased(Wallet)
+    q = (
+        select(Transfer.created_at, Transfer.amount_cents, src.user_id, dst.user_id, User.kyc_level, User.created_at)
+        .join(dst, dst.id == Transfer.to_wallet_id)
+        .outerjoin(src, src.id == Transfer.from_wallet_id)
+        .outerjoin(User, User.id == src.user_id)
+        .where(Transfer.status == "completed")
+        .order_by(Transfer.created_at)
+        .limit(limit)
+    )
+    if since:
+        q = q.where(and_(Transfer.created_at >= datetime.fromisoformat(since)))
+    db = SessionLocal()
+    try:
+        for ts, amount, from_user, to_user, kyc, created in db.execute(q).yield_per(5000):
+            if from_user is None:
+                yield {"ts": ts.timestamp(), "kind": "topup", "user_id": str(to_user), "amount_cents": amount, "context": "topup"}
+                continue
+            yield {
+                "ts": ts.timestamp(),
+                "kind": "send",
+                "user_id": str(from_user),
+                "counterparty": str(to_user),
+                "amount_cents": amount,
+                "context": "transfer",
+                "facts": {
+                    "kyc_level": int(kyc or 0),
+                    "account_age_days": (ts - created).days if created else 0,
+                    "hour_utc": ts.hour,
+                },
+            }
+    finally:
+        db.close()
+
+
+def _synthetic(n: int, seed: int = 7):
+    """``n`` transfers over a simulated day: mostly ordinary users plus a few bursty senders and shared devices."""
+    rnd = random.Random(seed)
+    users = [f"u{i}" for i in range(max(10, n // 20))]
+    bursty = users[: max(1, len(users) // 100)]
+    t = time.time() - 86400
+    for _ in range(n):
+        t += 86400 / n
+        burst = rnd.random() < 0.1
+        u = rnd.choice(bursty) if burst else rnd.choice(users)
+        dev = f"farm{rnd.randint(0, 4)}" if burst else f"d-{u}"
+        yield {
+            "ts": t,
+            "kind": "send",
+            "user_id": u,
+            "counterparty": rnd.choice(users),
+            "device": dev,
+            "amount_cents": int(rnd.lognormvariate(8, 1.5)),
+            "context": "p2p_transfer",
+            "facts": {"kyc_level": rnd.choice([0, 1, 1, 2]), "account_age_days": rnd.randint(0, 400), "hour_utc": int(t // 3600) % 24},
+        }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rules", action="append", default=[], help="candidate rule set JSON file (repeatable)")
+    ap.add_argument("--baseline", choices=["builtin", "db", "none"], default="builtin")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--events", help="JSONL file of recorded events, oldest first")
+    src.add_argument("--db", action="store_true", help="read completed transfers from DB_URL")
+    src.add_argument("--synthetic", type=int, help="generate N synthetic transfers")
+    ap.add_argument("--since", help="with --db: ISO timestamp of the first transfer")
+    ap.add_argument("--limit", type=int, default=200_000, help="with --db: max transfers")
+    args = ap.parse_args()
+
+    rulesets = {}
+    if args.baseline == "builtin":
+        from app.utils.risk import default_rules  # type: ignore
+
+        rulesets["builtin"] = RuleSet.from_dict(default_rules())
+    elif args.baseline == "db":
+        from app.utils.risk import load_rules  # type: ignore
+
+        rulesets["db-active"] = RuleSet.from_dict(load_rules()["active"])
+    for path in args.rules:
+        with open(path, "r", encoding="utf-8") as f:
+            rulesets[os.path.basename(path)] = RuleSet.from_dict(json.load(f))
+    if not rulesets:
+        ap.error("no rule sets: pass --rules or a baseline")
+
+    if args.events:
+        events = _jsonl(args.events)
+    elif args.db:
+        events = _db_events(args.since, args.limit)
+    else:
+        events = _synthetic(args.synthetic)
+    print(json.dumps(replay(events, rulesets), indent=2))
+
+
+if __name__ == "__main__":
+    main()
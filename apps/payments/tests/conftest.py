@@ -4,6 +4,8 @@ import os
 # Ensure sensible defaults for tests before app import
 os.environ.setdefault("ENV", "dev")
 os.environ.setdefault("RL_EXEMPT_OTP", "true")
+# The admin router is mounted only when a token is set as the app is created, i.e. by the first test module importing app.main
+os.environ.setdefault("ADMIN_TOKEN", "test-admin")
 
 
 def _boost_limits():
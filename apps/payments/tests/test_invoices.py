@@ -96,3 +96,104 @@ def test_invoice_autopay_process_due():
     pr = client.post("/invoices/process_due", headers=Hp)
     assert pr.status_code == 200, pr.text
     assert inv_id in pr.json().get("processed", [])
+
+
+def _balance(phone: str) -> int:
+    from app.database import SessionLocal
+    from app.models import User, Wallet
+
+    db = SessionLocal()
+    try:
+        return db.query(Wallet.balance_cents).join(User, User.id == Wallet.user_id).filter(User.phone == phone).scalar()
+    finally:
+        db.close()
+
+
+def test_billing_run_batches_and_reports_failures():
+    from app.database import SessionLocal
+    from app.models import BillingRun, Invoice, LedgerEntry, Transfer, User
+    from app.routers.invoices import process_all_due_once
+
+    merchant_phone = unique_phone("9006")
+    Hm = auth(merchant_phone, "Merchant")
+    assert client.post("/kyc/dev/approve", headers=Hm).status_code == 200
+    assert client.post("/payments/dev/become_merchant", headers=Hm).status_code == 200
+
+    # rich: 3 invoices paid; poor: 2nd invoice fails on balance; capped: invoice above mandate cap
+    plan = {"rich": (50000, [4000, 5000, 6000]), "poor": (6000, [5000, 5000]), "capped": (50000, [20000])}
+    phones, inv_ids = {}, {}
+    for name, (topup, amounts) in plan.items():
+        phone = unique_phone("9007")
+        phones[name] = phone
+        H = auth(phone, name)
+        assert client.post("/kyc/dev/approve", headers=H).status_code == 200
+        r = client.post("/wallet/topup", headers=H, json={"amount_cents": topup, "idempotency_key": f"br-topup-{phone}"})
+        assert r.status_code == 200, r.text
+        rm = client.post("/invoices/mandates", headers=H, json={"issuer_phone": merchant_phone, "autopay": True, "max_amount_cents": 10000})
+        assert rm.status_code == 200, rm.text
+        inv_ids[name] = []
+        for amt in amounts:
+            r = client.post("/invoices", headers=Hm, json={"payer_phone": phone, "amount_cents": amt, "due_in_days": 0})
+            assert r.status_code == 200, r.text
+            inv_ids[name].append(r.json()["id"])
+            assert client.post(f"/invoices/{r.json()['id']}/dev_force_due", headers=H).status_code == 200
+
+    merchant_before = _balance(merchant_phone)
+    db = SessionLocal()
+    try:
+        payer_ids = [u for (u,) in db.query(User.id).filter(User.phone.in_(list(phones.values())))]
+    finally:
+        db.close()
+    scope = Invoice.payer_user_id.in_(payer_ids)
+
+    out = process_all_due_once(where=scope)
+    assert out["status"] == "completed", out
+    assert out["scanned"] == 6 and out["chunks"] == 1
+    assert out["paid_count"] == 4 and out["processed"] == 4, out
+    assert out["paid_cents"] == 4000 + 5000 + 6000 + 5000
+    assert out["reasons"] == {"insufficient_balance": 1, "over_mandate_limit": 1}
+    assert out["failures"] == [{"invoice_id": inv_ids["poor"][1], "reason": "insufficient_balance"}]
+    assert _balance(phones["rich"]) == 50000 - 15000
+    assert _balance(phones["poor"]) == 1000
+    assert _balance(merchant_phone) == merchant_before + 20000
+
+    db = SessionLocal()
+    try:
+        paid = db.query(Invoice).filter(Invoice.id.in_(inv_ids["rich"] + inv_ids["poor"][:1])).all()
+        assert {i.status for i in paid} == {"paid"}
+        for inv in paid:
+            t = db.get(Transfer, inv.paid_transfer_id)
+            assert t.idempotency_key == f"auto-invoice-{inv.id}" and t.amount_cents == inv.amount_cents
+            legs = db.query(LedgerEntry).filter(LedgerEntry.transfer_id == t.id).all()
+            assert sorted(e.amount_cents_signed for e in legs) == [-inv.amount_cents, inv.amount_cents]
+        run = db.get(BillingRun, out["id"])
+        assert run.paid_count == 4 and run.failed_count == 1 and run.skipped_count == 1
+    finally:
+        db.close()
+
+    # A second run charges nothing new
+    again = process_all_due_once(where=scope)
+    assert again["paid_count"] == 0 and again["scanned"] == 2
+    assert _balance(merchant_phone) == merchant_before + 20000
+
+
+def test_billing_run_does_not_double_charge_process_due_payment():
+    from app.routers.invoices import process_all_due_once
+    from app.models import Invoice
+
+    merchant_phone = unique_phone("9008")
+    payer_phone = unique_phone("9009")
+    Hm = auth(merchant_phone, "Merchant")
+    Hp = auth(payer_phone, "Payer")
+    for H in (Hm, Hp):
+        assert client.post("/kyc/dev/approve", headers=H).status_code == 200
+    assert client.post("/payments/dev/become_merchant", headers=Hm).status_code == 200
+    assert client.post("/wallet/topup", headers=Hp, json={"amount_cents": 9000, "idempotency_key": f"dc-{payer_phone}"}).status_code == 200
+    assert client.post("/invoices/mandates", headers=Hp, json={"issuer_phone": merchant_phone, "autopay": True}).status_code == 200
+    r = client.post("/invoices", headers=Hm, json={"payer_phone": payer_phone, "amount_cents": 7000, "due_in_days": 0})
+    inv_id = r.json()["id"]
+    client.post(f"/invoices/{inv_id}/dev_force_due", headers=Hp)
+    assert inv_id in client.post("/invoices/process_due", headers=Hp).json()["processed"]
+    out = process_all_due_once(where=Invoice.id == inv_id)
+    assert out["paid_count"] == 0
+    assert _balance(payer_phone) == 2000
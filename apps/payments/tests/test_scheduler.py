@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+
+from superapp_shared.scheduler import (
+    CronTrigger,
+    IntervalTrigger,
+    LeaseLost,
+    MemoryLeaseStore,
+    RedisLeaseStore,
+    Scheduler,
+    SqlLeaseStore,
+    partition_of,
+)
+
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+def _sql_store():
+    from app.database import engine
+
+    return SqlLeaseStore(engine)
+
+
+def _redis_store():
+    return RedisLeaseStore(REDIS_URL, prefix=f"sched-test-{uuid.uuid4().hex[:8]}")
+
+
+STORES = {"memory": MemoryLeaseStore, "sql": _sql_store, "redis": _redis_store}
+
+
+class _Clock:
+    def __init__(self):
+        self.t = 1_000_000.0
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.mark.parametrize("backend", sorted(STORES))
+def test_each_item_handled_exactly_once_across_instances(backend):
+    store = STORES[backend]()
+    service = f"t-{uuid.uuid4().hex[:8]}"
+    items = {i: 0 for i in range(400)}
+    fires = Counter()
+    active = Counter()
+    overlap = []
+    lock = threading.Lock()
+
+    def job(ctx):
+        with lock:
+            fires[(ctx.partition, ctx.scheduled_for)] += 1
+            active[ctx.partition] += 1
+            overlap.append(active[ctx.partition])
+        try:
+            for key in [k for k in items if ctx.owns(k)]:
+                if items[key]:
+                    continue
+                seen = items[key]
+                time.sleep(0.0005)  # widen the read-modify-write window a concurrent holder would hit
+                items[key] = seen + 1
+            time.sleep(0.005)
+        finally:
+            with lock:
+                active[ctx.partition] -= 1
+
+    scheds = [Scheduler(store, service=service, instance_id=f"i{n}", synchronous=True) for n in range(3)]
+    for s in scheds:
+        s.add_job("sweep", job, IntervalTrigger(0.05), partitions=6, lease_secs=5)
+
+    stop = threading.Event()
+
+    def loop(s):
+        while not stop.is_set():
+            s.tick()
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=loop, args=(s,)) for s in scheds]
+    for t in threads:
+        t.start()
+    time.sleep(1.5)
+    stop.set()
+    for t in threads:
+        t.join()
+    for s in scheds:
+        s.stop()
+
+    assert set(items.values()) == {1}
+    # A partition never ran on two instances at the same time
+    assert max(overlap) == 1
+    # No fire of any partition ran twice
+    assert fires and max(fires.values()) == 1
+    # Work was split across instances rather than done by one
+    assert sum(1 for s in scheds if s.stats["sweep"].runs) >= 2
+    hist = scheds[0].history("sweep", limit=5)
+    assert hist and hist[0]["status"] == "ok"
+
+
+def test_partitions_rebalance_when_instance_joins_and_leaves():
+    clock = _Clock()
+    store = MemoryLeaseStore(clock)
+    a = Scheduler(store, service="rb", instance_id="a", synchronous=True, member_ttl=10)
+    b = Scheduler(store, service="rb", instance_id="b", synchronous=True, member_ttl=10)
+    for s in (a, b):
+        s.add_job("j", lambda ctx: None, IntervalTrigger(60), partitions=4, lease_secs=30)
+    a.tick()
+    assert a.held_partitions("j") == [0, 1, 2, 3]
+    b.tick()  # b joins; a gives back its surplus on its next tick
+    a.tick()
+    b.tick()
+    assert len(a.held_partitions("j")) == 2 and len(b.held_partitions("j")) == 2
+    assert set(a.held_partitions("j")) | set(b.held_partitions("j")) == {0, 1, 2, 3}
+    # b disappears without releasing; after its member + lease TTLs a takes everything back
+    clock.t += 20
+    a.tick()
+    clock.t += 15
+    a.tick()
+    assert a.held_partitions("j") == [0, 1, 2, 3]
+
+
+def test_fencing_token_rejects_stale_holder():
+    clock = _Clock()
+    store = MemoryLeaseStore(clock)
+    seen = {}
+
+    def slow(ctx):
+        seen["token"] = ctx.token
+        # Lease expires mid-run and another instance takes over
+        clock.t += 31
+        assert store.acquire(ctx.key, "other", 30) == ctx.token + 1
+        ctx.check()
+
+    s = Scheduler(store, service="fence", instance_id="a", synchronous=True)
+    s.add_job("j", slow, IntervalTrigger(60), lease_secs=30)
+    assert s.tick() == 1
+    assert s.stats["j"].lease_lost == 1
+    assert s.history("j")[0]["status"] == "lease_lost"
+    # The stale holder can neither renew nor move the schedule
+    assert not store.renew("fence:j#0", "a", seen["token"], 30)
+    assert not store.set_next_due("fence:j#0", "a", seen["token"], datetime.now(timezone.utc))
+    s.tick()
+    assert s.held_partitions("j") == []
+
+
+def test_sql_tokens_monotonic_across_owners():
+    store = _sql_store()
+    key = f"k-{uuid.uuid4().hex[:8]}"
+    t1 = store.acquire(key, "a", 30)
+    assert store.acquire(key, "b", 30) is None
+    assert store.acquire(key, "a", 30) == t1  # re-acquire by holder keeps the token
+    store.release(key, "a", t1)
+    t2 = store.acquire(key, "b", 30)
+    assert t2 == t1 + 1
+    assert store.holder(key) == ("b", t2)
+
+
+def test_cron_trigger_next_fire():
+    t = datetime(2025, 1, 31, 23, 59, 30, tzinfo=timezone.utc)
+    assert CronTrigger("*/15 * * * *").next_after(t, t) == datetime(2025, 2, 1, 0, 0, tzinfo=timezone.utc)
+    assert CronTrigger("30 2 * * 1").next_after(t, t) == datetime(2025, 2, 3, 2, 30, tzinfo=timezone.utc)  # Monday
+    assert CronTrigger("0 0 29 2 *").next_after(t, t) == datetime(2028, 2, 29, 0, 0, tzinfo=timezone.utc)
+    with pytest.raises(ValueError):
+        CronTrigger("61 * * * *")
+
+
+def test_interval_trigger_coalesces_missed_fires_and_partition_is_stable():
+    trig = IntervalTrigger(10)
+    t0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    late = datetime(2025, 1, 1, 0, 5, tzinfo=timezone.utc)
+    assert (trig.next_after(t0, late) - late).total_seconds() == 10
+    assert partition_of("abc", 8) == partition_of("abc", 8)
+    assert {partition_of(i, 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def test_run_now_refuses_partition_held_elsewhere():
+    store = MemoryLeaseStore()
+    a = Scheduler(store, service="rn", instance_id="a", synchronous=True)
+    b = Scheduler(store, service="rn", instance_id="b", synchronous=True)
+    for s in (a, b):
+        s.add_job("j", lambda ctx: {"p": ctx.partition}, IntervalTrigger(60))
+    a.tick()
+    with pytest.raises(LeaseLost):
+        b.run_now("j")
+    assert a.run_now("j").result == '{"p": 0}'
@@ -46,3 +46,10 @@ def get_current_user(authorization: str | None = Header(default=None, alias="Aut
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unknown user")
     return u
 
+
+
+def get_optional_user(authorization: str | None = Header(default=None, alias="Authorization"), db: Session = Depends(get_db)) -> User | None:
+    """The caller when a bearer token is sent, else None (anonymous browsing)."""
+    if not authorization:
+        return None
+    return get_current_user(authorization, db)
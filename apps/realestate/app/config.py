@@ -30,6 +30,9 @@ class Settings:
     PAYMENTS_INTERNAL_SECRET: str = os.getenv("PAYMENTS_INTERNAL_SECRET", "dev_secret")
     FEE_WALLET_PHONE: str = os.getenv("FEE_WALLET_PHONE", "+963999999999")
     RESERVATION_FEE_CENTS: int = int(os.getenv("RESERVATION_FEE_CENTS", "500000"))  # 5,000 SYP
+    # Per-listing projections (fields, images, owner) cached for list pages; edits invalidate them on commit
+    LISTING_CACHE_MAXSIZE: int = int(os.getenv("LISTING_CACHE_MAXSIZE", "20000"))
+    LISTING_CACHE_TTL_SECS: float = float(os.getenv("LISTING_CACHE_TTL_SECS", "60"))
 
     @property
     def jwt_delta(self) -> timedelta:
@@ -11,6 +11,7 @@ except Exception:
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from superapp_shared.cache import register_prometheus_collector as register_cache_metrics
 
 from .config import settings
 from .database import engine, get_db
@@ -39,6 +40,9 @@ def create_app() -> FastAPI:
 
     if settings.AUTO_CREATE_SCHEMA:
         Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_listings_created_id ON listings (created_at, id)")
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_listings_owner ON listings (owner_phone)")
 
     @app.get("/health")
     def health():
@@ -68,6 +72,9 @@ def create_app() -> FastAPI:
             pass
         return response
 
+    # cache_* hit/miss/eviction metrics for the listing projection cache
+    register_cache_metrics()
+
     @app.get("/metrics")
     def metrics():
         return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -93,6 +100,7 @@ def create_app() -> FastAPI:
         db = next(get_db())
         try:
             u = ensure_user(db, payload.phone, payload.name)
+            db.commit()
             token = _make_token(str(u.id))
         finally:
             db.close()
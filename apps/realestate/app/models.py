@@ -21,7 +21,7 @@ class User(Base):
 
 class Listing(Base):
     __tablename__ = "listings"
-    __table_args__ = (Index("ix_listings_created", "created_at"),)
+    __table_args__ = (Index("ix_listings_created", "created_at"), Index("ix_listings_created_id", "created_at", "id"), Index("ix_listings_owner", "owner_phone"))
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     title = Column(String(160), nullable=False)
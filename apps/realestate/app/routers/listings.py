@@ -1,53 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy import select
+from ..auth import get_optional_user
 from ..database import get_db
-from ..models import Listing, ListingImage
+from ..models import Listing, User
 from ..schemas import ListingsListOut, ListingOut
+from .. import serializers
 
 
 router = APIRouter(prefix="/listings", tags=["listings"])
 
 
-def _to_out(db: Session, l: Listing) -> ListingOut:
-    imgs = db.query(ListingImage).filter(ListingImage.listing_id == l.id).order_by(ListingImage.sort_order.asc()).all()
-    return ListingOut(
-        id=str(l.id),
-        title=l.title,
-        city=l.city,
-        district=l.district,
-        type=l.type,
-        property_type=l.property_type,
-        price_cents=l.price_cents,
-        bedrooms=l.bedrooms,
-        bathrooms=l.bathrooms,
-        size_sqm=l.size_sqm,
-        owner_phone=l.owner_phone,
-        images=[im.url for im in imgs] or None,
-    )
-
-
 @router.get("", response_model=ListingsListOut)
-def list_listings(q: str | None = None, city: str | None = None, type: str | None = None, min_price: int | None = None, max_price: int | None = None, db: Session = Depends(get_db)):
-    qry = db.query(Listing)
+def list_listings(
+    q: str | None = None,
+    city: str | None = None,
+    type: str | None = None,
+    min_price: int | None = None,
+    max_price: int | None = None,
+    limit: int = Query(50, gt=0, le=100),
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    user: User | None = Depends(get_optional_user),
+    db: Session = Depends(get_db),
+):
+    """Newest listings first, keyset-paginated: pass ``next_cursor`` back as ``cursor``."""
+    stmt = select(Listing)
     if q:
         like = f"%{q.lower()}%"
-        qry = qry.filter((Listing.title.ilike(like)) | (Listing.description.ilike(like)))
+        stmt = stmt.where((Listing.title.ilike(like)) | (Listing.description.ilike(like)))
     if city:
-        qry = qry.filter(Listing.city.ilike(city))
+        stmt = stmt.where(Listing.city.ilike(city))
     if type in ("rent", "sale"):
-        qry = qry.filter(Listing.type == type)
+        stmt = stmt.where(Listing.type == type)
     if min_price is not None:
-        qry = qry.filter(Listing.price_cents >= int(min_price))
+        stmt = stmt.where(Listing.price_cents >= int(min_price))
     if max_price is not None:
-        qry = qry.filter(Listing.price_cents <= int(max_price))
-    rows = qry.order_by(Listing.created_at.desc()).limit(100).all()
-    return ListingsListOut(listings=[_to_out(db, l) for l in rows])
+        stmt = stmt.where(Listing.price_cents <= int(max_price))
+    try:
+        rows = db.execute(serializers.newest_first(stmt, cursor, limit)).scalars().all()
+    except serializers.InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    next_cursor = serializers.cursor_after(rows[limit - 1]) if len(rows) > limit else None
+    return ListingsListOut(listings=serializers.listing_outs(db, rows[:limit], user), next_cursor=next_cursor)
 
 
 @router.get("/{listing_id}", response_model=ListingOut)
-def get_listing(listing_id: str, db: Session = Depends(get_db)):
+def get_listing(listing_id: str, user: User | None = Depends(get_optional_user), db: Session = Depends(get_db)):
     l = db.get(Listing, listing_id)
     if l is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Listing not found")
-    return _to_out(db, l)
+    return serializers.listing_outs(db, [l], user)[0]
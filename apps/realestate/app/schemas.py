@@ -31,10 +31,14 @@ class ListingOut(BaseModel):
     size_sqm: Optional[float] = None
     images: Optional[List[str]] = None
     owner_phone: Optional[str] = None
+    owner_name: Optional[str] = None
+    # Set only for signed-in callers
+    is_favorite: Optional[bool] = None
 
 
 class ListingsListOut(BaseModel):
     listings: List[ListingOut]
+    next_cursor: Optional[str] = None
 
 
 class InquiryCreateIn(BaseModel):
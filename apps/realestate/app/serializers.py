@@ -0,0 +1,147 @@
+"""Listing serialization for whole pages in a fixed number of queries.
+
+``listing_outs`` turns a page of listings into ``ListingOut`` with one
+batched query per relation instead of one per listing: images
+(``listing_id IN (...)``) and owners (``phone IN (...)``) for listings not
+in the projection cache, plus the caller's favorite flags. A page costs the
+same number of queries whether it holds 5 listings or 100.
+
+The user-independent part of each listing (fields, images, owner name) is
+cached per listing id for ``LISTING_CACHE_TTL_SECS``. Writes that change it
+(listing edits, image changes, deletes) are collected at flush and dropped
+from the cache after the commit, so this process never serves a projection
+older than its last committed edit; other replicas catch up within the TTL.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import uuid
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import event, select, tuple_
+from sqlalchemy.orm import Session
+
+from superapp_shared.cache import BoundedTTLCache
+from superapp_shared.listing import InvalidCursor, decode_cursor, encode_cursor
+
+from .config import settings
+from .database import SessionLocal
+from .models import Favorite, Listing, ListingImage, User
+from .schemas import ListingOut
+
+projections = BoundedTTLCache("realestate_listings", maxsize=settings.LISTING_CACHE_MAXSIZE, ttl=settings.LISTING_CACHE_TTL_SECS)
+
+
+def _project(l: Listing, images: List[str], owner_name: Optional[str]) -> dict:
+    return {
+        "id": str(l.id),
+        "title": l.title,
+        "city": l.city,
+        "district": l.district,
+        "type": l.type,
+        "property_type": l.property_type,
+        "price_cents": l.price_cents,
+        "bedrooms": l.bedrooms,
+        "bathrooms": l.bathrooms,
+        "size_sqm": l.size_sqm,
+        "owner_phone": l.owner_phone,
+        "owner_name": owner_name,
+        "images": images or None,
+    }
+
+
+def _load_projections(db: Session, listings: Sequence[Listing]) -> Dict[str, dict]:
+    """Projections for listings missing from the cache: one query for images, one for owners."""
+    ids = [l.id for l in listings]
+    images: Dict[uuid.UUID, List[str]] = {i: [] for i in ids}
+    for lid, url in db.execute(
+        select(ListingImage.listing_id, ListingImage.url)
+        .where(ListingImage.listing_id.in_(ids))
+        .order_by(ListingImage.listing_id, ListingImage.sort_order.asc(), ListingImage.id)
+    ):
+        images[lid].append(url)
+    phones = {l.owner_phone for l in listings if l.owner_phone}
+    owners = dict(db.execute(select(User.phone, User.name).where(User.phone.in_(phones))).all()) if phones else {}
+    out = {}
+    for l in listings:
+        p = _project(l, images[l.id], owners.get(l.owner_phone))
+        projections.set(p["id"], p)
+        out[p["id"]] = p
+    return out
+
+
+def listing_outs(db: Session, listings: Sequence[Listing], user: Optional[User] = None) -> List[ListingOut]:
+    """``ListingOut`` for every listing, in order, with ``is_favorite`` set when a user is given."""
+    if not listings:
+        return []
+    found: Dict[str, dict] = {}
+    missing = []
+    for l in listings:
+        p = projections.get(str(l.id))
+        if p is None:
+            missing.append(l)
+        else:
+            found[p["id"]] = p
+    if missing:
+        found.update(_load_projections(db, missing))
+    favorites = set()
+    if user is not None:
+        favorites = {
+            str(lid) for lid in db.execute(
+                select(Favorite.listing_id).where(Favorite.user_id == user.id, Favorite.listing_id.in_([l.id for l in listings]))
+            ).scalars()
+        }
+    return [
+        ListingOut(**found[str(l.id)], is_favorite=(str(l.id) in favorites) if user is not None else None)
+        for l in listings
+    ]
+
+
+# -- keyset pages ----------------------------------------------------------------
+
+
+def cursor_after(l: Listing) -> str:
+    """Cursor resuming ``newest_first`` after ``l``."""
+    return encode_cursor("newest", l.created_at, l.id)
+
+
+def newest_first(stmt, cursor: Optional[str], limit: int):
+    """``stmt`` ordered newest first and limited to ``limit + 1`` rows (the extra one tells if there is a next page)."""
+    if cursor:
+        created, lid = decode_cursor(cursor, "newest", dt.datetime.fromisoformat)
+        stmt = stmt.where(tuple_(Listing.created_at, Listing.id) < tuple_(created, lid))
+    return stmt.order_by(Listing.created_at.desc(), Listing.id.desc()).limit(limit + 1)
+
+
+# -- invalidation ----------------------------------------------------------------
+
+
+def invalidate(listing_ids: Iterable) -> None:
+    for lid in listing_ids:
+        projections.delete(str(lid))
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changes(session, flush_context):
+    changed = session.info.setdefault("listing_invalidations", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Listing):
+            changed.add(obj.id)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ListingImage):
+            changed.add(obj.listing_id)
+        elif isinstance(obj, User) and obj not in session.new:
+            # A renamed owner shows up in every projection of their listings
+            changed.update(session.execute(select(Listing.id).where(Listing.owner_phone == obj.phone)).scalars())
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _invalidate_committed(session):
+    changed = session.info.pop("listing_invalidations", None)
+    if changed:
+        invalidate(changed)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_invalidations(session):
+    session.info.pop("listing_invalidations", None)
@@ -34,6 +34,7 @@ class Settings:
     CACHE_DEFAULT_TTL_SECS: int = int(os.getenv("CACHE_DEFAULT_TTL_SECS", "60"))
     CACHE_BACKEND: str = os.getenv("CACHE_BACKEND", "memory")  # memory|redis
     CACHE_REDIS_URL: str = os.getenv("CACHE_REDIS_URL", "redis://redis:6379/0")
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
     CACHE_PREWARM: bool = env_bool("CACHE_PREWARM", default=True)
     # OTP
     OTP_MODE: str = os.getenv("OTP_MODE", "dev")
@@ -26,6 +26,7 @@ from .routers import reviews as reviews_router
 from .routers import webhooks as webhooks_router
 from .routers import payments_webhook as payments_webhook_router
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from superapp_shared.cache import register_prometheus_collector as register_cache_metrics
 
 
 def create_app() -> FastAPI:
@@ -201,6 +202,9 @@ def create_app() -> FastAPI:
     def metrics():
         return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
+    # cache_* hit/miss/eviction metrics for bounded in-process caches
+    register_cache_metrics()
+
     app.include_router(auth_router.router)
     app.include_router(public_router.router)
     app.include_router(host_router.router)
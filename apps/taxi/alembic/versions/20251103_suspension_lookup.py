@@ -0,0 +1,24 @@
+"""partial indexes for active-suspension lookups
+
+Revision ID: 20251103_susp_lookup
+Revises: 20251010_loyalty_rewards
+Create Date: 2025-11-03
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '20251103_susp_lookup'
+down_revision = '20251010_loyalty_rewards'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_susp_user_active', 'suspensions', ['user_id', 'until'], postgresql_where=sa.text('active'))
+    op.create_index('ix_susp_driver_active', 'suspensions', ['driver_id', 'until'], postgresql_where=sa.text('active'))
+
+
+def downgrade():
+    op.drop_index('ix_susp_driver_active', table_name='suspensions')
+    op.drop_index('ix_susp_user_active', table_name='suspensions')
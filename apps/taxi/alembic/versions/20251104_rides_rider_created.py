@@ -0,0 +1,21 @@
+"""rider + created_at index for the velocity count
+
+Revision ID: 20251104_rides_rider_created
+Revises: 20251103_susp_lookup
+Create Date: 2025-11-04
+"""
+from alembic import op
+
+
+revision = '20251104_rides_rider_created'
+down_revision = '20251103_susp_lookup'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_rides_rider_created', 'rides', ['rider_user_id', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_rides_rider_created', table_name='rides')
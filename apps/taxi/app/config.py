@@ -52,6 +52,12 @@ class Settings:
     MAPS_MAX_RETRIES: int = int(os.getenv("MAPS_MAX_RETRIES", os.getenv("GOOGLE_MAX_RETRIES", "2")))
     MAPS_BACKOFF_SECS: float = float(os.getenv("MAPS_BACKOFF_SECS", os.getenv("GOOGLE_BACKOFF_SECS", "0.25")))
     MAPS_GEOCODER_CACHE_SECS: int = int(os.getenv("MAPS_GEOCODER_CACHE_SECS", "120"))
+    # Routing provider: google (Directions API, haversine fallback) | local (offline road graph)
+    MAPS_PROVIDER: str = os.getenv("MAPS_PROVIDER", "google")
+    ROUTING_GRAPH_PATH: str | None = os.getenv("ROUTING_GRAPH_PATH") or None  # .osm XML or edge-list file
+    ROUTING_SPEED_PROFILE_PATH: str | None = os.getenv("ROUTING_SPEED_PROFILE_PATH") or None
+    ROUTING_MAX_SNAP_KM: float = float(os.getenv("ROUTING_MAX_SNAP_KM", "1.0"))
+    ROUTING_TZ_OFFSET_HOURS: int = int(os.getenv("ROUTING_TZ_OFFSET_HOURS", "3"))  # Syria (UTC+3)
     # Ride classes: price multipliers (e.g. "standard=1.0,comfort=1.1,yellow=1.0,vip=1.5,van=1.4,electro=0.95")
     RIDE_CLASS_MULTIPLIERS_RAW: str = os.getenv(
         "RIDE_CLASS_MULTIPLIERS",
@@ -112,8 +118,15 @@ class Settings:
     MQTT_BROKER_HOST: str | None = os.getenv("MQTT_BROKER_HOST")
     MQTT_BROKER_PORT: int = int(os.getenv("MQTT_BROKER_PORT", "1883"))
     MQTT_TOPIC_PREFIX: str = os.getenv("MQTT_TOPIC_PREFIX", "taxi")
+    # Driver location ingestion: "sync" writes DriverLocation in the request,
+    # "batched" coalesces pings per driver and bulk-upserts every flush interval
+    LOCATION_INGEST_MODE: str = os.getenv("LOCATION_INGEST_MODE", "sync")
+    LOCATION_FLUSH_INTERVAL_MS: int = int(os.getenv("LOCATION_FLUSH_INTERVAL_MS", "500"))
+    LOCATION_FLUSH_MAX_BATCH: int = int(os.getenv("LOCATION_FLUSH_MAX_BATCH", "2000"))
     # Caches
     MAPS_ROUTE_CACHE_SECS: int = int(os.getenv("MAPS_ROUTE_CACHE_SECS", "60"))
+    MAPS_ROUTE_CACHE_MAX_ENTRIES: int = int(os.getenv("MAPS_ROUTE_CACHE_MAX_ENTRIES", "5000"))
+    MAPS_GEOCODER_CACHE_MAX_ENTRIES: int = int(os.getenv("MAPS_GEOCODER_CACHE_MAX_ENTRIES", "5000"))
     # Rate limiting
     RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory|redis
     RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
@@ -144,6 +157,15 @@ class Settings:
     FRAUD_MIN_TRIP_KM: float = float(os.getenv("FRAUD_MIN_TRIP_KM", "0.2"))
     FRAUD_AUTOSUSPEND_ON_VELOCITY: bool = os.getenv("FRAUD_AUTOSUSPEND_ON_VELOCITY", "false").lower() == "true"
     FRAUD_AUTOSUSPEND_MINUTES: int = int(os.getenv("FRAUD_AUTOSUSPEND_MINUTES", "10"))
+    # Suspension lookups: per-subject cache (admin changes invalidate it on every replica via Redis pub/sub)
+    SUSPENSION_CACHE_TTL_SECS: float = float(os.getenv("SUSPENSION_CACHE_TTL_SECS", "30"))
+    SUSPENSION_CACHE_MAXSIZE: int = int(os.getenv("SUSPENSION_CACHE_MAXSIZE", "200000"))
+    SUSPENSION_CACHE_BROADCAST: bool = env_bool("SUSPENSION_CACHE_BROADCAST", default=True)
+    # Marks lapsed time-bounded suspensions inactive (0 = disabled; lookups ignore them either way)
+    SUSPENSION_EXPIRE_INTERVAL_SECS: int = int(os.getenv("SUSPENSION_EXPIRE_INTERVAL_SECS", "0"))
+    # Risk engine: JSON rule set file (hot-reloaded; empty = built-in rules from FRAUD_* above), RISK_MODE=enforce|shadow
+    RISK_RULES_PATH: str = os.getenv("RISK_RULES_PATH", "")
+    RISK_RULES_RELOAD_SECS: int = int(os.getenv("RISK_RULES_RELOAD_SECS", "10"))
     # Admin
     ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
     ADMIN_IP_ALLOWLIST: str = os.getenv("ADMIN_IP_ALLOWLIST", "")  # comma-separated IPs
@@ -154,6 +176,12 @@ class Settings:
     REASSIGN_RADIUS_FACTOR: float = float(os.getenv("REASSIGN_RADIUS_FACTOR", "1.0"))
     REASSIGN_RELAX_WALLET: bool = os.getenv("REASSIGN_RELAX_WALLET", "false").lower() == "true"
     ACCEPTED_START_TIMEOUT_SECS: int = int(os.getenv("ACCEPTED_START_TIMEOUT_SECS", "300"))
+    # Scheduled reaper for accept/start timeouts (0 = disabled; admin endpoints still work)
+    TAXI_REAPER_INTERVAL_SECS: int = int(os.getenv("TAXI_REAPER_INTERVAL_SECS", "0"))
+    # Scheduled /rides/reassign_stale scan, dev only like the endpoint (0 = disabled)
+    TAXI_REASSIGN_STALE_INTERVAL_SECS: int = int(os.getenv("TAXI_REASSIGN_STALE_INTERVAL_SECS", "0"))
+    TAXI_REASSIGN_STALE_MINUTES: int = int(os.getenv("TAXI_REASSIGN_STALE_MINUTES", "2"))
+    SCHEDULER_PARTITIONS: int = int(os.getenv("SCHEDULER_PARTITIONS", "4"))
     # JWT & internal secrets rotation
     JWT_SECRET_PREV: str | None = os.getenv("JWT_SECRET_PREV")
     JWT_SECRETS_LIST_RAW: str | None = os.getenv("JWT_SECRETS")
@@ -226,5 +254,8 @@ if not settings.DEV_MODE:
         raise RuntimeError("Provide ADMIN_TOKEN or ADMIN_TOKEN_SHA256 when ENV!=dev")
     if settings.OTP_SMS_PROVIDER.lower() == "http" and not settings.OTP_SMS_HTTP_URL:
         raise RuntimeError("OTP_SMS_HTTP_URL must be set when OTP_SMS_PROVIDER=http")
-    if not settings.GOOGLE_MAPS_API_KEY:
+    if settings.MAPS_PROVIDER.lower() == "local":
+        if not settings.ROUTING_GRAPH_PATH:
+            raise RuntimeError("ROUTING_GRAPH_PATH must be set when MAPS_PROVIDER=local")
+    elif not settings.GOOGLE_MAPS_API_KEY:
         raise RuntimeError("GOOGLE_MAPS_API_KEY must be set when ENV!=dev")
@@ -0,0 +1,345 @@
+"""Driver location ingestion pipeline.
+
+``PUT /driver/location`` used to do everything inline on every ping: upsert
+``DriverLocation``, look up the active ride, broadcast over WebSocket via
+``anyio.from_thread.run`` and open a fresh MQTT connection with
+``publish.multiple``. At thousands of drivers pinging every few seconds that
+is one broker handshake and four DB round trips per ping.
+
+``LocationIngestor`` takes pings off the request path:
+
+- pings are coalesced per driver; only the latest position inside a flush
+  interval is written/published,
+- a single background flusher bulk-upserts the batch (``INSERT .. ON
+  CONFLICT``) and resolves active rides for all drivers in one query,
+- WebSocket broadcasts are scheduled onto the app event loop without the
+  request waiting for them,
+- MQTT goes through one persistent, auto-reconnecting client.
+
+``LOCATION_INGEST_MODE=sync`` (default) keeps the DB write in the request for
+read-your-writes (matching right after a ping); only fan-out is deferred.
+``batched`` defers the write too; readers then lag by at most
+``LOCATION_FLUSH_INTERVAL_MS``.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from .config import settings
+
+
+log = logging.getLogger(__name__)
+
+ACTIVE_RIDE_STATUSES = ("assigned", "accepted", "enroute")
+
+
+@dataclass
+class LocationPing:
+    driver_id: str
+    lat: float
+    lon: float
+    ts: datetime
+    ride_id: Optional[str] = None
+    # True when the row still needs to be written by the flusher
+    persist: bool = True
+
+
+def _iso(ts: datetime) -> str:
+    return ts.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class MqttPublisher:
+    """One long-lived paho client; publishes are queued by paho's network loop."""
+
+    def __init__(self, host: str, port: int = 1883, client_id: str = "taxi-api", keepalive: int = 30, client=None):
+        self.host = host
+        self.port = port
+        self._client = client
+        self._client_id = client_id
+        self._keepalive = keepalive
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        if self._started:
+            return self._client
+        with self._lock:
+            if self._started:
+                return self._client
+            if self._client is None:
+                from paho.mqtt import client as mqtt
+
+                try:
+                    self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=self._client_id)
+                except AttributeError:  # paho-mqtt < 2.0
+                    self._client = mqtt.Client(client_id=self._client_id)
+                self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+                self._client.connect_async(self.host, self.port, keepalive=self._keepalive)
+                self._client.loop_start()
+            self._started = True
+        return self._client
+
+    def publish_many(self, msgs: List[tuple]) -> None:
+        client = self._ensure()
+        for topic, body, qos, retain in msgs:
+            client.publish(topic, body, qos=qos, retain=retain)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None and self._started:
+                try:
+                    self._client.loop_stop()
+                    self._client.disconnect()
+                except Exception:
+                    pass
+            self._started = False
+
+
+def _db_sink(pings: List[LocationPing]) -> Dict[str, str]:
+    """Bulk-upsert locations and return {driver_id: active_ride_id} for the batch."""
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+    from .database import SessionLocal
+    from .models import DriverLocation, Ride
+
+    db = SessionLocal()
+    try:
+        rows = [
+            {"driver_id": p.driver_id, "lat": p.lat, "lon": p.lon, "updated_at": p.ts.replace(tzinfo=None)}
+            for p in pings
+            if p.persist
+        ]
+        if rows:
+            stmt = pg_insert(DriverLocation.__table__).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DriverLocation.__table__.c.driver_id],
+                set_={"lat": stmt.excluded.lat, "lon": stmt.excluded.lon, "updated_at": stmt.excluded.updated_at},
+                # Never let a late batch overwrite a newer position
+                where=DriverLocation.__table__.c.updated_at <= stmt.excluded.updated_at,
+            )
+            db.execute(stmt)
+        need_ride = [p.driver_id for p in pings if p.ride_id is None]
+        active: Dict[str, str] = {}
+        if need_ride:
+            q = (
+                db.query(Ride.driver_id, Ride.id)
+                .filter(Ride.driver_id.in_(need_ride))
+                .filter(Ride.status.in_(ACTIVE_RIDE_STATUSES))
+                .order_by(Ride.created_at.asc())
+            )
+            for drv_id, ride_id in q.all():
+                active[str(drv_id)] = str(ride_id)  # newest wins (ascending order)
+        db.commit()
+        return active
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _broadcast(ride_id: str, payload: dict) -> None:
+    from .ws_manager import ride_ws_manager
+
+    await ride_ws_manager.broadcast_ride_status(ride_id, payload)
+
+
+class LocationIngestor:
+    """Coalesces driver pings and flushes them in batches from one thread."""
+
+    def __init__(
+        self,
+        *,
+        sink: Callable[[List[LocationPing]], Dict[str, str]] = _db_sink,
+        publisher: Optional[MqttPublisher] = None,
+        broadcaster: Callable[[str, dict], object] = _broadcast,
+        interval_secs: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        topic_prefix: Optional[str] = None,
+        autostart: bool = True,
+    ):
+        self.sink = sink
+        self.publisher = publisher
+        self.broadcaster = broadcaster
+        self.autostart = autostart
+        self.interval_secs = (
+            interval_secs if interval_secs is not None else int(getattr(settings, "LOCATION_FLUSH_INTERVAL_MS", 500)) / 1000.0
+        )
+        self.max_batch = max_batch or int(getattr(settings, "LOCATION_FLUSH_MAX_BATCH", 2000))
+        self.topic_prefix = (topic_prefix or getattr(settings, "MQTT_TOPIC_PREFIX", None) or "taxi").strip("/")
+        self._pending: Dict[str, LocationPing] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"received": 0, "coalesced": 0, "flushed": 0, "batches": 0, "errors": 0, "published": 0, "broadcasts": 0}
+
+    # -- request path ------------------------------------------------------
+
+    def submit(self, ping: LocationPing) -> None:
+        """O(1) enqueue; a newer ping for the same driver replaces the pending one."""
+        with self._lock:
+            self.stats["received"] += 1
+            prev = self._pending.get(ping.driver_id)
+            if prev is not None:
+                self.stats["coalesced"] += 1
+                if prev.ts > ping.ts:
+                    return
+                # Keep the write obligation if either ping still needs persisting
+                ping.persist = ping.persist or prev.persist
+                ping.ride_id = ping.ride_id or prev.ride_id
+            self._pending[ping.driver_id] = ping
+            full = len(self._pending) >= self.max_batch
+        if self._thread is None and self.autostart:
+            self.start()
+        if full:
+            self._wake.set()
+
+    def bind_loop(self, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        if loop is not None:
+            self._loop = loop
+
+    @property
+    def has_loop(self) -> bool:
+        return self._loop is not None and not self._loop.is_closed()
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.bind_loop(loop)
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="location-ingest", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        t = self._thread
+        if t is not None:
+            t.join(timeout)
+        self._thread = None
+        self.flush()
+        if self.publisher is not None:
+            self.publisher.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval_secs)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:  # pragma: no cover - flush already isolates errors
+                log.exception("location flush failed")
+
+    # -- flushing ----------------------------------------------------------
+
+    def flush(self) -> int:
+        """Drain pending pings in ``max_batch`` chunks; returns pings processed.
+
+        Pings requeued after a sink failure wait for the next flush rather than
+        being retried in a tight loop.
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending = {}
+        for i in range(0, len(pending), self.max_batch):
+            self._process(pending[i:i + self.max_batch])
+        return len(pending)
+
+    def _requeue(self, batch: List[LocationPing]) -> None:
+        with self._lock:
+            for p in batch:
+                cur = self._pending.get(p.driver_id)
+                if cur is None:
+                    self._pending[p.driver_id] = p
+                elif p.persist and cur.ts >= p.ts:
+                    cur.persist = True
+
+    def _process(self, batch: List[LocationPing]) -> None:
+        try:
+            active = self.sink(batch)
+        except Exception:
+            self.stats["errors"] += 1
+            log.warning("location sink failed; requeueing %d pings", len(batch), exc_info=True)
+            # Only positions that still need persisting are retried; fan-out is best-effort
+            retry = [p for p in batch if p.persist]
+            if retry and not self._stop.is_set():
+                self._requeue(retry)
+            return
+        self.stats["batches"] += 1
+        self.stats["flushed"] += len(batch)
+        for p in batch:
+            if p.ride_id is None:
+                p.ride_id = active.get(p.driver_id)
+        self._fan_out(batch)
+
+    def _fan_out(self, batch: List[LocationPing]) -> None:
+        if self.publisher is not None:
+            msgs: List[tuple] = []
+            for p in batch:
+                body = {"driver_id": p.driver_id, "lat": p.lat, "lon": p.lon, "ts": _iso(p.ts)}
+                msgs.append((f"{self.topic_prefix}/driver/{p.driver_id}/location", json.dumps(body), 0, False))
+                if p.ride_id:
+                    ride_body = body | {"ride_id": p.ride_id}
+                    msgs.append((f"{self.topic_prefix}/ride/{p.ride_id}/driver_location", json.dumps(ride_body), 0, False))
+            try:
+                self.publisher.publish_many(msgs)
+                self.stats["published"] += len(msgs)
+            except Exception:
+                log.warning("mqtt publish failed", exc_info=True)
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        for p in batch:
+            if not p.ride_id:
+                continue
+            payload = {"type": "driver_location", "ride_id": p.ride_id, "lat": p.lat, "lon": p.lon, "ts": _iso(p.ts)}
+            try:
+                coro = self.broadcaster(p.ride_id, payload)
+                if asyncio.iscoroutine(coro):
+                    asyncio.run_coroutine_threadsafe(coro, loop)
+                self.stats["broadcasts"] += 1
+            except Exception:
+                pass
+
+
+_ingestor: Optional[LocationIngestor] = None
+_ingestor_lock = threading.Lock()
+
+
+def get_location_ingestor() -> LocationIngestor:
+    global _ingestor
+    if _ingestor is None:
+        with _ingestor_lock:
+            if _ingestor is None:
+                publisher = None
+                if getattr(settings, "MQTT_BROKER_HOST", None):
+                    publisher = MqttPublisher(
+                        settings.MQTT_BROKER_HOST,
+                        int(getattr(settings, "MQTT_BROKER_PORT", 1883)),
+                    )
+                _ingestor = LocationIngestor(publisher=publisher)
+    return _ingestor
+
+
+def batched_mode() -> bool:
+    return (getattr(settings, "LOCATION_INGEST_MODE", "sync") or "sync").lower() == "batched"
+
+
+__all__ = [
+    "LocationPing",
+    "LocationIngestor",
+    "MqttPublisher",
+    "get_location_ingestor",
+    "batched_mode",
+]
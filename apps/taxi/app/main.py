@@ -27,10 +27,15 @@ from .routers import admin as admin_router
 from .routers import push as push_router
 from .routers import wallet as wallet_router
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from superapp_shared.cache import register_prometheus_collector as register_cache_metrics
+from superapp_shared.idempotency import IdempotencyMiddleware, idempotency_store_from_env, register_prometheus_collector as register_idempotency_metrics
+from superapp_shared.risk import RiskContextMiddleware, register_prometheus_collector as register_risk_metrics
 from fastapi import Response
 from .middleware_request_id import RequestIDMiddleware
 from .middleware_rate_limit import SlidingWindowLimiter
 from .middleware_rate_limit_redis import RedisRateLimiter
+from .location_ingest import get_location_ingestor
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, sql_partition_clause, store_from_env
 import os
 try:
     import sentry_sdk
@@ -38,6 +43,74 @@ except Exception:
     sentry_sdk = None
 
 
+def build_scheduler(app=None, store=None, **kw) -> Scheduler:
+    """Scheduler running the ride timeout reapers, the dev stale-ride scan and suspension expiry under leases (``app`` binds broadcasts to its loop)."""
+    import asyncio
+    from .database import SessionLocal
+    from .models import Ride
+    from .ws_manager import ride_ws_manager
+
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="taxi", **kw)
+    loop_ref: dict = {}
+
+    if app is not None:
+        @app.on_event("startup")
+        async def _bind_reaper_loop():
+            loop_ref["loop"] = asyncio.get_running_loop()
+
+    def _notify(ride_id, payload):
+        # Jobs run on scheduler threads; hand websocket broadcasts to the app loop
+        loop = loop_ref.get("loop")
+        if loop is not None and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(ride_ws_manager.broadcast_ride_status(ride_id, payload), loop)
+
+    def _job(kind):
+        def run(ctx):
+            db = SessionLocal()
+            try:
+                out = rides_router.reap_timed_out_rides(db, kind, notify=_notify, where=sql_partition_clause(Ride.id, ctx))
+                ctx.check()
+                db.commit()
+                return out
+            finally:
+                db.close()
+        return run
+
+    def _reassign_stale(ctx):
+        db = SessionLocal()
+        try:
+            out = rides_router.reassign_stale_rides(db, settings.TAXI_REASSIGN_STALE_MINUTES, notify=_notify, where=sql_partition_clause(Ride.id, ctx))
+            ctx.check()
+            db.commit()
+            return out
+        finally:
+            db.close()
+
+    def _expire_suspensions(ctx):
+        from .suspensions import get_registry
+
+        db = SessionLocal()
+        try:
+            n = get_registry().expire_lapsed(db)
+            db.commit()
+            return {"expired": n}
+        finally:
+            db.close()
+
+    secs = settings.TAXI_REAPER_INTERVAL_SECS
+    for name, kind in (("reap_accept_timeouts", "accept_timeout"), ("reap_start_timeouts", "start_timeout")):
+        sched.add_job(name, _job(kind), IntervalTrigger(max(secs, 1)), partitions=settings.SCHEDULER_PARTITIONS, lease_secs=max(30, secs * 3), enabled=secs > 0)
+    # Dev only, like the /rides/reassign_stale endpoint it runs
+    stale_secs = settings.TAXI_REASSIGN_STALE_INTERVAL_SECS
+    sched.add_job(
+        "reassign_stale", _reassign_stale, IntervalTrigger(max(stale_secs, 1)), partitions=settings.SCHEDULER_PARTITIONS,
+        lease_secs=max(30, stale_secs * 3), enabled=stale_secs > 0 and settings.ENV == "dev",
+    )
+    expire_secs = settings.SUSPENSION_EXPIRE_INTERVAL_SECS
+    sched.add_job("expire_suspensions", _expire_suspensions, IntervalTrigger(max(expire_secs, 1)), lease_secs=max(30, expire_secs * 3), enabled=expire_secs > 0)
+    return sched
+
+
 def create_app() -> FastAPI:
     # Optional Sentry init
     dsn = os.getenv("SENTRY_DSN", "").strip()
@@ -59,6 +132,15 @@ def create_app() -> FastAPI:
 
     # Request ID + JSON logs
     app.add_middleware(RequestIDMiddleware)
+    # Device key (X-Device-ID or IP/UA fingerprint) for the risk engine's per-device features
+    app.add_middleware(RiskContextMiddleware)
+    # Idempotency-Key on ride requests and wallet moves: retries replay the first response
+    app.add_middleware(
+        IdempotencyMiddleware,
+        store=idempotency_store_from_env(engine, settings.REDIS_URL, prefix="idem:taxi"),
+        service="taxi",
+        paths=["/rides/request", "/driver/taxi_wallet"],
+    )
     # Trusted hosts + forwarded headers
     allowed_hosts = getattr(settings, "ALLOWED_HOSTS", None) or ["*"]
     app.add_middleware(TrustedHostMiddleware, allowed_hosts=allowed_hosts)
@@ -101,6 +183,7 @@ def create_app() -> FastAPI:
                 conn.execute(text("ALTER TABLE IF EXISTS rides ADD COLUMN IF NOT EXISTS passenger_name TEXT"))
                 conn.execute(text("ALTER TABLE IF EXISTS rides ADD COLUMN IF NOT EXISTS passenger_phone TEXT"))
                 conn.execute(text("ALTER TABLE IF EXISTS rides ADD COLUMN IF NOT EXISTS payer_mode TEXT"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_rides_rider_created ON rides (rider_user_id, created_at)"))
                 conn.commit()
         except Exception:
             pass
@@ -144,6 +227,27 @@ def create_app() -> FastAPI:
     def metrics():
         return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
+    # cache_* hit/miss/eviction metrics for bounded in-process caches
+    register_cache_metrics()
+    # risk_* decision / shadow disagreement / reload metrics
+    register_risk_metrics()
+    # idempotency_requests_total{outcome=executed|replayed|coalesced|conflicts|...}
+    register_idempotency_metrics()
+
+    @app.on_event("startup")
+    async def _start_location_ingest():
+        import asyncio
+        get_location_ingestor().start(asyncio.get_running_loop())
+
+    @app.on_event("shutdown")
+    def _stop_location_ingest():
+        # Final flush so batched pings are not lost on deploy
+        get_location_ingestor().stop()
+
+    if settings.TAXI_REAPER_INTERVAL_SECS > 0 or settings.SUSPENSION_EXPIRE_INTERVAL_SECS > 0:
+        # One replica reaps each partition of stuck rides instead of every replica racing
+        install_scheduler(app, build_scheduler(app))
+
     app.include_router(auth_router.router)
     app.include_router(driver_router.router)
     app.include_router(rides_router.router)
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta, timezone
 from typing import List
 import httpx
+import threading
 import time
 
+from superapp_shared.cache import BoundedTTLCache
+
 from .config import settings
 from .utils import haversine_km
 
@@ -54,24 +56,21 @@ class GoogleMapsProvider:
         self.api_key = (settings.GOOGLE_MAPS_API_KEY or "").strip()
         self.use_traffic = bool(getattr(settings, "GOOGLE_USE_TRAFFIC", True))
         self.cache_ttl = max(0, int(getattr(settings, "MAPS_ROUTE_CACHE_SECS", 60)))
-        self._cache: dict[str, tuple[datetime, tuple[float, int, str | None]]] = {}
+        self._cache = BoundedTTLCache(
+            "taxi_routes",
+            maxsize=max(1, int(getattr(settings, "MAPS_ROUTE_CACHE_MAX_ENTRIES", 5000))),
+            ttl=max(1, self.cache_ttl),
+        )
 
-    def _cache_get(self, key: str):
+    def _cache_get(self, key: tuple):
         if self.cache_ttl <= 0:
             return None
-        ent = self._cache.get(key)
-        if not ent:
-            return None
-        exp, val = ent
-        if exp >= datetime.now(timezone.utc):
-            return val
-        self._cache.pop(key, None)
-        return None
+        return self._cache.get(key)
 
-    def _cache_set(self, key: str, value: tuple[float, int, str | None]):
+    def _cache_set(self, key: tuple, value: tuple[float, int, str | None]):
         if self.cache_ttl <= 0:
             return
-        self._cache[key] = (datetime.now(timezone.utc) + timedelta(seconds=self.cache_ttl), value)
+        self._cache.set(key, value)
 
     def _offline_route(self, points: List[tuple[float, float]]) -> tuple[float, int, str | None]:
         dist = 0.0
@@ -85,7 +84,8 @@ class GoogleMapsProvider:
     def route(self, points: List[tuple[float, float]], want_polyline: bool = False) -> tuple[float, int, str | None]:
         if len(points) < 2:
             return 0.0, 1, None
-        cache_key = f"google|{'poly' if want_polyline else 'nop'}|{points}"
+        # Hashable key on rounded coordinates (~0.1 m) instead of str(points)
+        cache_key = ("google", bool(want_polyline), tuple((round(lat, 6), round(lon, 6)) for lat, lon in points))
         cached = self._cache_get(cache_key)
         if cached is not None:
             return cached
@@ -175,11 +175,20 @@ class GoogleMapsProvider:
         return dist_km, mins
 
 
-_provider: GoogleMapsProvider | None = None
+_provider = None
+_provider_lock = threading.Lock()
 
 
-def get_maps_provider() -> GoogleMapsProvider:
+def get_maps_provider():
+    """Configured provider: Google (default) or the offline road graph (MAPS_PROVIDER=local)."""
     global _provider
     if _provider is None:
-        _provider = GoogleMapsProvider()
+        with _provider_lock:
+            if _provider is None:
+                if (getattr(settings, "MAPS_PROVIDER", "google") or "google").lower() == "local":
+                    from .routing import load_local_provider
+
+                    _provider = load_local_provider()
+                else:
+                    _provider = GoogleMapsProvider()
     return _provider
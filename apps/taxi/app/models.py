@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 from sqlalchemy import (
-    Column, String, Integer, DateTime, Boolean, ForeignKey, Float, Index, UniqueConstraint, JSON
+    Column, String, Integer, DateTime, Boolean, ForeignKey, Float, Index, UniqueConstraint, JSON, text
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base, relationship
@@ -60,7 +60,11 @@ class DriverLocation(Base):
 
 class Ride(Base):
     __tablename__ = "rides"
-    __table_args__ = (Index("ix_rides_created", "created_at"),)
+    __table_args__ = (
+        Index("ix_rides_created", "created_at"),
+        # Rider velocity check without a shared feature store
+        Index("ix_rides_rider_created", "rider_user_id", "created_at"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     rider_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -306,6 +310,9 @@ class Suspension(Base):
         Index("ix_susp_user", "user_id"),
         Index("ix_susp_driver", "driver_id"),
         Index("ix_susp_active_until", "active", "until"),
+        # Hot-path lookups (SuspensionRegistry): only active rows are indexed
+        Index("ix_susp_user_active", "user_id", "until", postgresql_where=text("active")),
+        Index("ix_susp_driver_active", "driver_id", "until", postgresql_where=text("active")),
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
@@ -9,6 +9,7 @@ from ..auth import get_db, get_current_user
 from ..config import settings
 from ..models import FraudEvent, Suspension, User, Driver
 from ..payments_cb import snapshot as cb_snapshot, reset as cb_reset
+from ..suspensions import DRIVER, USER, get_registry
 
 
 router = APIRouter(prefix="/admin", tags=["admin"]) 
@@ -86,12 +87,7 @@ def create_suspension(payload: SuspensionIn, db: Session = Depends(get_db), _: N
         if not d:
             raise HTTPException(status_code=404, detail="driver_not_found")
         driver_id = d.id
-from datetime import datetime, timedelta, timezone
-    until = None
-    if payload.minutes and payload.minutes > 0:
-        until = datetime.now(timezone.utc) + timedelta(minutes=payload.minutes)
-    s = Suspension(user_id=user_id, driver_id=driver_id, reason=(payload.reason or None), until=until, active=True)
-    db.add(s); db.flush()
+    s = get_registry().suspend(db, user_id=user_id, driver_id=driver_id, reason=(payload.reason or None), minutes=payload.minutes)
     return {"id": str(s.id), "active": s.active, "until": s.until.isoformat() + "Z" if s.until else None}
 
 
@@ -156,8 +152,7 @@ def toggle_suspension(susp_id: str, payload: ToggleIn, db: Session = Depends(get
     s = db.get(Suspension, susp_id)
     if not s:
         raise HTTPException(status_code=404, detail="not_found")
-    s.active = bool(payload.active)
-    db.flush()
+    get_registry().set_active(db, s, payload.active)
     return {"id": susp_id, "active": s.active}
 
 
@@ -174,20 +169,13 @@ def unsuspend_target(payload: UnsuspendIn, db: Session = Depends(get_db), _: Non
     if payload.user_phone:
         u = db.query(User).filter(User.phone == payload.user_phone).one_or_none()
         if u:
-            rows = db.query(Suspension).filter(Suspension.user_id == u.id, Suspension.active == True).all()  # noqa: E712
-            for s in rows:
-                s.active = False
-                updated += 1
+            updated += get_registry().lift(db, USER, u.id)
     if payload.driver_phone:
         u = db.query(User).filter(User.phone == payload.driver_phone).one_or_none()
         if u:
             d = db.query(Driver).filter(Driver.user_id == u.id).one_or_none()
             if d:
-                rows = db.query(Suspension).filter(Suspension.driver_id == d.id, Suspension.active == True).all()  # noqa: E712
-                for s in rows:
-                    s.active = False
-                    updated += 1
-    db.flush()
+                updated += get_registry().lift(db, DRIVER, d.id)
     return {"unsuspended": updated}
 
 
@@ -235,6 +223,21 @@ def admin_ui(request: Request, db: Session = Depends(get_db), _: None = Depends(
     for s in susp:
         html.append(f"<li>{esc(str(s.id))} active={s.active} until={esc(s.until.isoformat()+'Z' if s.until else '-')}</li>")
     html.append("</ul>")
+    html.append("<h2>Recent Fraud Events</h2><ul>")
+    for e in events:
+        html.append(f"<li>{esc(e.created_at.isoformat()+'Z')} {esc(e.type)} user={esc(str(e.user_id or '-'))} driver={esc(str(e.driver_id or '-'))}</li>")
+    html.append("</ul>")
+    # Payments CB status + reset button
+    tok = request.headers.get('X-Admin-Token', '')
+    html.append("<h2>Payments Circuit Breaker</h2>")
+    html.append("<button id=cbreset>CB Reset</button> <span id=cbmsg></span>")
+    html.append("<script>document.getElementById('cbreset').onclick = async function(){\n  const r = await fetch('/admin/payments/cb_reset', {method:'POST', headers:{'X-Admin-Token':'" + esc(tok) + "'}});\n  document.getElementById('cbmsg').innerText = r.ok ? 'reset ok' : ('error ' + r.status);\n  setTimeout(()=>{location.reload();}, 500);\n};</script>")
+    html.append("<ul>")
+    for op, st in cb_snapshot().items():
+        html.append(f"<li>{esc(op)}: fails={int(st.get('fails',0))}, open={st.get('open')}, until={esc(st.get('open_until') or '-')}</li>")
+    html.append("</ul>")
+    html.append("</body></html>")
+    return Response(content="".join(html), media_type="text/html")
 
 
 class DriverClassIn(BaseModel):
@@ -376,21 +379,6 @@ def admin_list_drivers(
             "created_at": d.created_at.isoformat() + "Z",
         })
     return {"items": out, "limit": limit, "offset": offset}
-    html.append("<h2>Recent Fraud Events</h2><ul>")
-    for e in events:
-        html.append(f"<li>{esc(e.type)} at {esc(e.created_at.isoformat()+'Z')}</li>")
-    html.append("</ul>")
-    # Payments CB status + reset button
-    tok = request.headers.get('X-Admin-Token', '')
-    html.append("<h2>Payments Circuit Breaker</h2>")
-    html.append("<button id=cbreset>CB Reset</button> <span id=cbmsg></span>")
-    html.append("<script>document.getElementById('cbreset').onclick = async function(){\n  const r = await fetch('/admin/payments/cb_reset', {method:'POST', headers:{'X-Admin-Token':'" + esc(tok) + "'}});\n  document.getElementById('cbmsg').innerText = r.ok ? 'reset ok' : ('error ' + r.status);\n  setTimeout(()=>{location.reload();}, 500);\n};</script>")
-    html.append("<ul>")
-    for op, st in cb_snapshot().items():
-        html.append(f"<li>{esc(op)}: fails={int(st.get('fails',0))}, open={st.get('open')}, until={esc(st.get('open_until') or '-')}</li>")
-    html.append("</ul>")
-    html.append("</body></html>")
-    return Response("\n".join(html), media_type="text/html")
 
 
 @router.get("/payments/cb_status")
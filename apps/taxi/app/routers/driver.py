@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, status
@@ -6,10 +7,9 @@ from sqlalchemy import func
 
 from ..auth import get_current_user, get_db
 from ..models import User, Driver, DriverLocation, Ride, RideRating, TaxiWallet
-from ..ws_manager import ride_ws_manager
+from ..location_ingest import LocationPing, batched_mode, get_location_ingestor
 from ..schemas import DriverApplyIn, DriverStatusIn, DriverLocationIn, UserOut, DriverRatingsOut, DriverProfileOut
 from ..utils_fraud import is_suspended_driver
-from ..config import settings
 
 
 router = APIRouter(prefix="/driver", tags=["driver"])
@@ -58,64 +58,39 @@ def update_location(payload: DriverLocationIn, user: User = Depends(get_current_
     drv = db.query(Driver).filter(Driver.user_id == user.id).one()
     if is_suspended_driver(db, str(drv.id)):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="driver_suspended")
+    ingestor = get_location_ingestor()
+    if not ingestor.has_loop:
+        # Broadcasts are scheduled onto the app loop from the flusher thread
+        try:
+            import anyio
+            ingestor.bind_loop(anyio.from_thread.run_sync(asyncio.get_running_loop))
+        except Exception:
+            pass
+    now = datetime.now(timezone.utc)
+    if batched_mode():
+        # Upsert, active-ride lookup and fan-out all happen in the next flush
+        ingestor.submit(LocationPing(str(drv.id), payload.lat, payload.lon, now))
+        return {"detail": "ok"}
     loc = db.query(DriverLocation).filter(DriverLocation.driver_id == drv.id).one_or_none()
     if loc is None:
-        loc = DriverLocation(driver_id=drv.id, lat=payload.lat, lon=payload.lon, updated_at=datetime.now(timezone.utc))
+        loc = DriverLocation(driver_id=drv.id, lat=payload.lat, lon=payload.lon, updated_at=now)
         db.add(loc)
     else:
         loc.lat = payload.lat
         loc.lon = payload.lon
-        loc.updated_at = datetime.now(timezone.utc)
+        loc.updated_at = now
     db.flush()
-    # Broadcast to rider if driver has an active ride (assigned/accepted/enroute)
     active = (
-        db.query(Ride)
+        db.query(Ride.id)
         .filter(Ride.driver_id == drv.id)
         .filter(Ride.status.in_(["assigned", "accepted", "enroute"]))
         .order_by(Ride.created_at.desc())
         .first()
     )
-    if active is not None:
-        try:
-            import datetime as _dt
-            payload_ws = {
-                "type": "driver_location",
-                "ride_id": str(active.id),
-                "lat": payload.lat,
-                "lon": payload.lon,
-                "ts": _dt.datetime.now(_dt.timezone.utc).isoformat().replace("+00:00", "Z"),
-            }
-            # fire and forget
-            import anyio
-            anyio.from_thread.run(ride_ws_manager.broadcast_ride_status, str(active.id), payload_ws)
-        except Exception:
-            pass
-    # Optional MQTT publish for realtime streams
-    try:
-        if settings.MQTT_BROKER_HOST:
-            import json
-            from paho.mqtt import publish as _pub
-            topic_pref = (settings.MQTT_TOPIC_PREFIX or "taxi").strip("/")
-            # Publish per-driver and per-ride topics
-            base_payload = {
-                "driver_id": str(drv.id),
-                "lat": payload.lat,
-                "lon": payload.lon,
-                "ts": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
-            }
-            msgs = [(f"{topic_pref}/driver/{drv.id}/location", json.dumps(base_payload), 0, False)]
-            if active is not None:
-                ride_msg = base_payload | {"ride_id": str(active.id)}
-                msgs.append((f"{topic_pref}/ride/{active.id}/driver_location", json.dumps(ride_msg), 0, False))
-            _pub.multiple(
-                msgs,
-                hostname=settings.MQTT_BROKER_HOST,
-                port=int(getattr(settings, "MQTT_BROKER_PORT", 1883)),
-                client_id="taxi-api",
-                keepalive=10,
-            )
-    except Exception:
-        pass
+    # WebSocket broadcast and MQTT publish are handled off the request path
+    ingestor.submit(
+        LocationPing(str(drv.id), payload.lat, payload.lon, now, ride_id=str(active[0]) if active else "", persist=False)
+    )
     return {"detail": "ok"}
 
 
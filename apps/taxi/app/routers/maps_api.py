@@ -1,13 +1,13 @@
 from __future__ import annotations
 
 import time
-from datetime import datetime, timedelta, timezone
-from typing import Callable, Dict, Tuple
+from typing import Callable, Tuple
 
 import httpx
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from prometheus_client import Counter
 from sqlalchemy.orm import Session
+from superapp_shared.cache import BoundedTTLCache
 
 from ..auth import get_current_user, get_db
 from ..config import settings
@@ -18,30 +18,24 @@ GEOCODER_CALLS = Counter("taxi_maps_geocoder_calls_total", "Geocoder calls", ["t
 TRAFFIC_CALLS = Counter("taxi_maps_traffic_calls_total", "Traffic API calls", ["type", "result"])  # type: flow|incidents
 
 
-def _ttl_cache(ttl_secs: int) -> Tuple[Callable[[str], dict | None], Callable[[str, dict], None]]:
-    store: Dict[str, Tuple[datetime, dict]] = {}
-
-    def get(key: str):
-        ent = store.get(key)
-        if not ent:
-            return None
-        exp, val = ent
-        if exp >= datetime.now(timezone.utc):
-            return val
-        store.pop(key, None)
-        return None
+def _ttl_cache(name: str, ttl_secs: int) -> Tuple[Callable[[str], dict | None], Callable[[str, dict], None]]:
+    cache = BoundedTTLCache(
+        name,
+        maxsize=max(1, int(getattr(settings, "MAPS_GEOCODER_CACHE_MAX_ENTRIES", 5000))),
+        ttl=max(1, ttl_secs),
+    )
 
     def set_(key: str, val: dict):
         if ttl_secs <= 0:
             return
-        store[key] = (datetime.now(timezone.utc) + timedelta(seconds=ttl_secs), val)
+        cache.set(key, val)
 
-    return get, set_
+    return cache.get, set_
 
 
 _cache_secs = max(0, int(getattr(settings, "MAPS_GEOCODER_CACHE_SECS", 120)))
-_rev_get, _rev_set = _ttl_cache(_cache_secs)
-_auto_get, _auto_set = _ttl_cache(_cache_secs)
+_rev_get, _rev_set = _ttl_cache("taxi_maps_reverse", _cache_secs)
+_auto_get, _auto_set = _ttl_cache("taxi_maps_autocomplete", _cache_secs)
 
 
 def _maps_timeout() -> float:
@@ -14,7 +14,7 @@ import httpx
 from ..ws_manager import ride_ws_manager, driver_ws_manager
 from ..utils import haversine_km
 from ..maps import get_maps_provider
-from ..utils_fraud import enforce_rider_velocity, require_driver_location_fresh_and_near, is_suspended_user, is_suspended_driver, record_fraud_event
+from ..utils_fraud import enforce_rider_velocity, require_driver_location_fresh_and_near, is_suspended_user, is_suspended_driver, record_fraud_event, observe_ride_event
 from ..push import send_push_to_user
 from ..payments_cb import allowed as pay_allowed, record as pay_record
 from prometheus_client import Counter, Histogram
@@ -452,6 +452,7 @@ def request_ride(payload: RideRequestIn, request: Request, user: User = Depends(
     except Exception:
         # Non-fatal: if escrow fails due to network or other, return 502 so client can retry or fallback
         raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="escrow_error")
+    observe_ride_event("request", str(user.id), amount_cents=ride.quoted_fare_cents or 0)
     return RideOut(
         id=str(ride.id),
         status=ride.status,
@@ -977,6 +978,8 @@ def complete_ride(
         "driver_reward_fee_waived": bool(getattr(ride, "driver_reward_fee_waived", False)),
     }
     background_tasks.add_task(ride_ws_manager.broadcast_ride_status, ride_id, payload)
+    if just_completed:
+        observe_ride_event("complete", str(ride.rider_user_id), amount_cents=ride.final_fare_cents or 0, counterparty=str(ride.driver_id) if ride.driver_id else None)
     # Notify driver channel about completion
     try:
         import anyio
@@ -1107,6 +1110,7 @@ def cancel_by_rider(ride_id: str, background_tasks: BackgroundTasks, payload: Ca
     # fraud: track cancel event (for later ratios)
     try:
         record_fraud_event(db, user_id=str(user.id), type="rider.cancel", data={"ride_id": ride_id})
+        observe_ride_event("cancel", str(user.id))
     except Exception:
         pass
     return {"detail": "canceled"}
@@ -1228,24 +1232,22 @@ def reassign_ride(ride_id: str, background_tasks: BackgroundTasks, user: User =
     return {"detail": "reassigned" if ride.driver_id else "no_driver"}
 
 
-@router.post("/reassign_stale")
-def reassign_stale(
-    background_tasks: BackgroundTasks,
-    minutes: int = 2,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
-):
-    # DEV helper: scan requested/assigned older than threshold and try reassignment
+def reassign_stale_rides(db: Session, minutes: int = 2, notify=None, where=None) -> dict:
+    """Try to reassign requested/assigned rides older than ``minutes`` whose driver is not busy (DEV helper).
+
+    Shared by the dev endpoint and the dev-only ``reassign_stale`` scheduled job.
+    ``notify(ride_id, payload)`` receives status broadcasts; ``where`` narrows the scan (scheduler partition).
+    """
     from datetime import datetime, timedelta
-    if settings.ENV != "dev":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
     cutoff = datetime.now(timezone.utc) - timedelta(minutes=minutes)
-    candidates = (
+    q = (
         db.query(Ride)
         .filter(Ride.created_at <= cutoff)
         .filter(Ride.status.in_(["requested", "assigned"]))
-        .all()
     )
+    if where is not None:
+        q = q.filter(where)
+    candidates = q.all()
     count = 0
     for ride in candidates:
         # if assigned but driver busy, skip; try to improve only if no driver or driver is offline
@@ -1269,11 +1271,11 @@ def reassign_stale(
         )
         if new_drv and _assign_driver(db, ride, new_drv):
             count += 1
-            background_tasks.add_task(
-                ride_ws_manager.broadcast_ride_status,
-                str(ride.id),
-                {"type": "ride_status", "ride_id": str(ride.id), "status": ride.status, "driver_id": str(ride.driver_id)},
-            )
+            if notify is not None:
+                notify(
+                    str(ride.id),
+                    {"type": "ride_status", "ride_id": str(ride.id), "status": ride.status, "driver_id": str(ride.driver_id)},
+                )
             try:
                 REASSIGN_EVENTS.labels("stale_scan", "assigned").inc()
             except Exception:
@@ -1286,6 +1288,24 @@ def reassign_stale(
     return {"reassigned": count, "scanned": len(candidates)}
 
 
+@router.post("/reassign_stale")
+def reassign_stale(
+    background_tasks: BackgroundTasks,
+    minutes: int = 2,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # DEV helper: scan requested/assigned older than threshold and try reassignment
+    # (also the ``reassign_stale`` job when TAXI_REASSIGN_STALE_INTERVAL_SECS>0 in dev)
+    if settings.ENV != "dev":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+    return reassign_stale_rides(
+        db,
+        minutes,
+        notify=lambda ride_id, payload: background_tasks.add_task(ride_ws_manager.broadcast_ride_status, ride_id, payload),
+    )
+
+
 def _is_admin_token_valid(incoming: str | None) -> bool:
     if not incoming:
         return False
@@ -1316,30 +1336,43 @@ def _require_admin(x_admin_token: str | None = Header(default=None, alias="X-Adm
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="admin_ip_blocked")
 
 
-@router.post("/reap_timeouts")
-def reap_timeouts(
-    background_tasks: BackgroundTasks,
-    accept_timeout_secs: int | None = None,
+_REAP_KINDS = {
+    # kind: (status, baseline column name, settings timeout attr, default secs)
+    "accept_timeout": ("assigned", "created_at", "ASSIGNMENT_ACCEPT_TIMEOUT_SECS", 120),
+    "start_timeout": ("accepted", "accepted_at", "ACCEPTED_START_TIMEOUT_SECS", 300),
+}
+
+
+def reap_timed_out_rides(
+    db: Session,
+    kind: str,
+    timeout_secs: int | None = None,
     limit: int | None = None,
     relax_wallet: bool | None = None,
-    _: None = Depends(_require_admin),
-    db: Session = Depends(get_db),
-):
-    """Reap assigned rides that have not been accepted within timeout and try reassignment.
+    notify=None,
+    where=None,
+) -> dict:
+    """Free the driver of rides stuck in ``kind`` past the timeout and try reassignment.
 
-    Intended to be invoked periodically (cron). Uses created_at as baseline for MVP.
+    Shared by the admin endpoints and the scheduled reaper job. ``notify(ride_id, payload)``
+    receives status broadcasts; ``where`` narrows the scan (scheduler partition).
     """
     from datetime import datetime, timedelta
-    acc_to = int(accept_timeout_secs or getattr(settings, "ASSIGNMENT_ACCEPT_TIMEOUT_SECS", 120))
+    status_, col_name, timeout_attr, default_secs = _REAP_KINDS[kind]
+    timeout = int(timeout_secs or getattr(settings, timeout_attr, default_secs))
     lim = int(limit or getattr(settings, "REASSIGN_SCAN_LIMIT", 200))
     relax = bool(relax_wallet if relax_wallet is not None else getattr(settings, "REASSIGN_RELAX_WALLET", False))
-    cutoff = datetime.now(timezone.utc) - timedelta(seconds=acc_to)
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=timeout)
+    col = getattr(Ride, col_name)
     q = (
         db.query(Ride)
-        .filter(Ride.created_at <= cutoff)
-        .filter(Ride.status == "assigned")
-        .order_by(Ride.created_at.asc())
+        .filter(Ride.status == status_)
+        .filter(col != None)  # noqa: E711
+        .filter(col <= cutoff)
+        .order_by(col.asc())
     )
+    if where is not None:
+        q = q.filter(where)
     if lim > 0:
         q = q.limit(lim)
     items = q.all()
@@ -1367,20 +1400,44 @@ def reap_timeouts(
         if new_drv and _assign_driver(db, ride, new_drv):
             reassigned += 1
             try:
-                TIMEOUT_REAPED.labels("accept_timeout", "assigned").inc()
+                TIMEOUT_REAPED.labels(kind, "assigned").inc()
             except Exception:
                 pass
-            background_tasks.add_task(
-                ride_ws_manager.broadcast_ride_status,
-                str(ride.id),
-                {"type": "ride_status", "ride_id": str(ride.id), "status": ride.status, "driver_id": str(ride.driver_id)},
-            )
+            if notify is not None:
+                notify(
+                    str(ride.id),
+                    {"type": "ride_status", "ride_id": str(ride.id), "status": ride.status, "driver_id": str(ride.driver_id)},
+                )
         else:
             try:
-                TIMEOUT_REAPED.labels("accept_timeout", "none").inc()
+                TIMEOUT_REAPED.labels(kind, "none").inc()
             except Exception:
                 pass
-    return {"reassigned": reassigned, "scanned": len(items), "accept_timeout_secs": acc_to}
+    return {"reassigned": reassigned, "scanned": len(items), f"{kind}_secs": timeout}
+
+
+@router.post("/reap_timeouts")
+def reap_timeouts(
+    background_tasks: BackgroundTasks,
+    accept_timeout_secs: int | None = None,
+    limit: int | None = None,
+    relax_wallet: bool | None = None,
+    _: None = Depends(_require_admin),
+    db: Session = Depends(get_db),
+):
+    """Reap assigned rides that have not been accepted within timeout and try reassignment.
+
+    Also runs as the ``reap_accept_timeouts`` scheduled job (TAXI_REAPER_INTERVAL_SECS).
+    Uses created_at as baseline for MVP.
+    """
+    return reap_timed_out_rides(
+        db,
+        "accept_timeout",
+        accept_timeout_secs,
+        limit,
+        relax_wallet,
+        notify=lambda rid, payload: background_tasks.add_task(ride_ws_manager.broadcast_ride_status, rid, payload),
+    )
 
 
 @router.post("/reap_start_timeouts")
@@ -1393,59 +1450,14 @@ def reap_start_timeouts(
     db: Session = Depends(get_db),
 ):
     """Reap accepted rides that did not transition to enroute within timeout and try reassignment."""
-    from datetime import datetime, timedelta
-    st_to = int(start_timeout_secs or getattr(settings, "ACCEPTED_START_TIMEOUT_SECS", 300))
-    lim = int(limit or getattr(settings, "REASSIGN_SCAN_LIMIT", 200))
-    relax = bool(relax_wallet if relax_wallet is not None else getattr(settings, "REASSIGN_RELAX_WALLET", False))
-    cutoff = datetime.now(timezone.utc) - timedelta(seconds=st_to)
-    q = (
-        db.query(Ride)
-        .filter(Ride.status == "accepted")
-        .filter(Ride.accepted_at != None)  # noqa: E711
-        .filter(Ride.accepted_at <= cutoff)
-        .order_by(Ride.accepted_at.asc())
+    return reap_timed_out_rides(
+        db,
+        "start_timeout",
+        start_timeout_secs,
+        limit,
+        relax_wallet,
+        notify=lambda rid, payload: background_tasks.add_task(ride_ws_manager.broadcast_ride_status, rid, payload),
     )
-    if lim > 0:
-        q = q.limit(lim)
-    items = q.all()
-    reassigned = 0
-    for ride in items:
-        # free current driver
-        if ride.driver_id:
-            cur = db.get(Driver, ride.driver_id)
-            if cur:
-                cur.status = "available"
-        ride.driver_id = None
-        prev = ride.status
-        ride.status = "requested"
-        _count_transition(prev, ride.status)
-        fee_bps = settings.PLATFORM_FEE_BPS
-        required_fee = int(((ride.quoted_fare_cents or 0) * fee_bps + 5000) // 10000) if fee_bps else 0
-        new_drv = _find_nearest_available_driver(
-            db,
-            ride.pickup_lat,
-            ride.pickup_lon,
-            required_fee,
-            relax_min_balance=relax,
-            radius_km=float(getattr(settings, "ASSIGN_RADIUS_KM", 5)) * float(getattr(settings, "REASSIGN_RADIUS_FACTOR", 1.0)),
-        )
-        if new_drv and _assign_driver(db, ride, new_drv):
-            reassigned += 1
-            try:
-                TIMEOUT_REAPED.labels("start_timeout", "assigned").inc()
-            except Exception:
-                pass
-            background_tasks.add_task(
-                ride_ws_manager.broadcast_ride_status,
-                str(ride.id),
-                {"type": "ride_status", "ride_id": str(ride.id), "status": ride.status, "driver_id": str(ride.driver_id)},
-            )
-        else:
-            try:
-                TIMEOUT_REAPED.labels("start_timeout", "none").inc()
-            except Exception:
-                pass
-    return {"reassigned": reassigned, "scanned": len(items), "start_timeout_secs": st_to}
 
 
 @router.post("/{ride_id}/rate")
@@ -0,0 +1,413 @@
+"""Offline road routing for fare quotes and ETAs.
+
+Loads a road graph from an OSM XML extract (``.osm``) or a plain edge-list
+file and answers shortest-travel-time queries with A* over a compact
+adjacency (CSR) layout. Edge travel times are scaled by a time-of-day speed
+profile per road class, so rush-hour quotes are slower than night quotes.
+
+``LocalRoutingProvider`` has the same interface as ``GoogleMapsProvider``
+(``route`` / ``eta_minutes`` / ``route_distance_duration``) and never touches
+the network, which makes quotes deterministic and testable.
+
+Edge-list format (comma or whitespace separated, ``#`` comments)::
+
+    from_lat,from_lon,to_lat,to_lon[,speed_kmph[,oneway[,road_class]]]
+
+``oneway`` is 1/0 (default 0, i.e. the edge is added in both directions).
+"""
+from __future__ import annotations
+
+import heapq
+import json
+import math
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from superapp_shared.cache import BoundedTTLCache
+
+from .config import settings
+from .utils import haversine_km
+
+
+ROAD_CLASSES = ("motorway", "trunk", "primary", "secondary", "tertiary", "residential", "service", "other")
+_CLASS_INDEX = {c: i for i, c in enumerate(ROAD_CLASSES)}
+
+# Free-flow defaults (km/h) per OSM highway tag
+_HIGHWAY_SPEEDS: Dict[str, Tuple[str, float]] = {
+    "motorway": ("motorway", 100.0),
+    "motorway_link": ("motorway", 60.0),
+    "trunk": ("trunk", 80.0),
+    "trunk_link": ("trunk", 50.0),
+    "primary": ("primary", 60.0),
+    "primary_link": ("primary", 40.0),
+    "secondary": ("secondary", 50.0),
+    "secondary_link": ("secondary", 35.0),
+    "tertiary": ("tertiary", 40.0),
+    "tertiary_link": ("tertiary", 30.0),
+    "unclassified": ("other", 30.0),
+    "residential": ("residential", 30.0),
+    "living_street": ("residential", 10.0),
+    "service": ("service", 15.0),
+}
+
+_EARTH_M = 6371000.0
+
+
+def _class_of(name: Optional[str]) -> int:
+    return _CLASS_INDEX.get((name or "other").strip().lower(), _CLASS_INDEX["other"])
+
+
+class SpeedProfile:
+    """Per road class, per hour-of-day multipliers applied to free-flow speed."""
+
+    def __init__(self, table: Optional[Dict[str, Sequence[float]]] = None):
+        default = [1.0] * 24
+        self._rows: List[List[float]] = []
+        table = table or {}
+        base = list(table.get("default") or default)
+        for cls in ROAD_CLASSES:
+            row = list(table.get(cls) or base)
+            if len(row) != 24:
+                raise ValueError(f"speed profile for {cls!r} must have 24 hourly values")
+            self._rows.append([max(0.05, float(v)) for v in row])
+
+    @classmethod
+    def default(cls) -> "SpeedProfile":
+        # Weekday pattern: morning and evening peaks hit arterials hardest
+        arterial = [1.1] * 6 + [0.85, 0.6, 0.6, 0.8] + [0.85] * 4 + [0.8, 0.75, 0.6, 0.6, 0.65, 0.85] + [1.0] * 4
+        local = [1.05] * 6 + [0.9, 0.75, 0.75, 0.9] + [0.9] * 4 + [0.9, 0.85, 0.75, 0.75, 0.8, 0.9] + [1.0] * 4
+        return cls({
+            "default": local,
+            "motorway": arterial,
+            "trunk": arterial,
+            "primary": arterial,
+            "secondary": arterial,
+        })
+
+    @classmethod
+    def from_file(cls, path: str) -> "SpeedProfile":
+        with open(path, "r", encoding="utf-8") as fh:
+            return cls(json.load(fh))
+
+    def multiplier(self, road_class: int, hour: int) -> float:
+        return self._rows[road_class][hour % 24]
+
+    def max_multiplier(self) -> float:
+        return max(max(r) for r in self._rows)
+
+
+class RoadGraph:
+    """Directed road graph in CSR form with a grid index for snapping."""
+
+    def __init__(
+        self,
+        lats: Sequence[float],
+        lons: Sequence[float],
+        edges: Iterable[Tuple[int, int, float, float, int]],
+        *,
+        cell_deg: float = 0.002,
+    ):
+        self.lat = array("d", lats)
+        self.lon = array("d", lons)
+        n = len(self.lat)
+        ordered = sorted(edges, key=lambda e: e[0])
+        self.offsets = array("l", [0] * (n + 1))
+        self.targets = array("l")
+        self.length_m = array("d")
+        self.speed_kmph = array("d")
+        self.road_class = array("b")
+        for u, v, length, speed, cls in ordered:
+            self.offsets[u + 1] += 1
+            self.targets.append(v)
+            self.length_m.append(length)
+            self.speed_kmph.append(max(1.0, speed))
+            self.road_class.append(cls)
+        for i in range(n):
+            self.offsets[i + 1] += self.offsets[i]
+        self.max_speed_kmph = max(self.speed_kmph) if len(self.speed_kmph) else 1.0
+        self.cell_deg = cell_deg
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        for i in range(n):
+            self._grid.setdefault(self._cell(self.lat[i], self.lon[i]), []).append(i)
+        self._weights: Dict[Tuple[int, int], array] = {}
+        self._weights_lock = threading.Lock()
+
+    @property
+    def node_count(self) -> int:
+        return len(self.lat)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    # -- builders ----------------------------------------------------------
+
+    @classmethod
+    def from_edge_list(cls, path: str) -> "RoadGraph":
+        builder = _GraphBuilder()
+        with open(path, "r", encoding="utf-8") as fh:
+            for raw in fh:
+                line = raw.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                parts = [p for p in line.replace(",", " ").split() if p]
+                if len(parts) < 4:
+                    raise ValueError(f"edge line needs at least 4 fields: {raw.strip()!r}")
+                lat1, lon1, lat2, lon2 = (float(p) for p in parts[:4])
+                speed = float(parts[4]) if len(parts) > 4 else float(getattr(settings, "AVG_SPEED_KMPH", 30.0))
+                oneway = len(parts) > 5 and parts[5].strip().lower() in ("1", "true", "yes")
+                road = parts[6] if len(parts) > 6 else "other"
+                builder.add((lat1, lon1), (lat2, lon2), speed, oneway, _class_of(road))
+        return builder.build()
+
+    @classmethod
+    def from_osm_xml(cls, path: str) -> "RoadGraph":
+        """Parse an OSM XML extract; only ``highway=*`` ways are kept."""
+        coords: Dict[str, Tuple[float, float]] = {}
+        ways: List[Tuple[List[str], Dict[str, str]]] = []
+        for _, elem in ET.iterparse(path, events=("end",)):
+            if elem.tag == "node":
+                coords[elem.get("id", "")] = (float(elem.get("lat", 0.0)), float(elem.get("lon", 0.0)))
+                elem.clear()
+            elif elem.tag == "way":
+                tags = {t.get("k", ""): t.get("v", "") for t in elem.findall("tag")}
+                if tags.get("highway") in _HIGHWAY_SPEEDS:
+                    ways.append(([nd.get("ref", "") for nd in elem.findall("nd")], tags))
+                elem.clear()
+        builder = _GraphBuilder()
+        for refs, tags in ways:
+            road, speed = _HIGHWAY_SPEEDS[tags["highway"]]
+            maxspeed = (tags.get("maxspeed") or "").split(" ")[0]
+            if maxspeed.isdigit():
+                speed = float(maxspeed)
+            oneway = (tags.get("oneway") or "").lower()
+            reverse = oneway == "-1"
+            is_oneway = oneway in ("yes", "1", "true", "-1") or tags.get("junction") == "roundabout"
+            pts = [coords[r] for r in refs if r in coords]
+            if reverse:
+                pts.reverse()
+            for a, b in zip(pts, pts[1:]):
+                builder.add(a, b, speed, is_oneway, _class_of(road))
+        return builder.build()
+
+    @classmethod
+    def from_file(cls, path: str) -> "RoadGraph":
+        if path.lower().endswith((".osm", ".xml")):
+            return cls.from_osm_xml(path)
+        return cls.from_edge_list(path)
+
+    # -- queries -----------------------------------------------------------
+
+    def nearest_node(self, lat: float, lon: float, max_km: float = 1.0) -> Optional[int]:
+        """Closest node within ``max_km`` (grid ring search), or None."""
+        ci, cj = self._cell(lat, lon)
+        cos_lat = max(0.01, math.cos(math.radians(lat)))
+        max_ring = int(math.ceil(max_km / (111.0 * self.cell_deg * cos_lat))) + 1
+        best: Optional[int] = None
+        # Compare squared equirectangular distances (km^2); exact enough at snap range
+        best_d2 = max_km * max_km
+        lat_arr, lon_arr = self.lat, self.lon
+        for ring in range(0, max_ring + 1):
+            for di in range(-ring, ring + 1):
+                for dj in range(-ring, ring + 1):
+                    if max(abs(di), abs(dj)) != ring:
+                        continue
+                    for node in self._grid.get((ci + di, cj + dj), ()):
+                        dy = (lat_arr[node] - lat) * 111.195
+                        dx = (lon_arr[node] - lon) * 111.195 * cos_lat
+                        d2 = dx * dx + dy * dy
+                        if d2 <= best_d2:
+                            best, best_d2 = node, d2
+            # Anything in a further ring is at least ring * cell away
+            if best is not None and math.sqrt(best_d2) < ring * 111.0 * self.cell_deg * cos_lat:
+                break
+        return best
+
+    def _weights_for(self, profile: SpeedProfile, hour: int) -> array:
+        key = (id(profile), hour)
+        w = self._weights.get(key)
+        if w is not None:
+            return w
+        with self._weights_lock:
+            w = self._weights.get(key)
+            if w is None:
+                mult = [profile.multiplier(c, hour) for c in range(len(ROAD_CLASSES))]
+                w = array("d", (
+                    self.length_m[e] / (self.speed_kmph[e] * mult[self.road_class[e]] / 3.6)
+                    for e in range(self.edge_count)
+                ))
+                self._weights[key] = w
+        return w
+
+    def shortest_path(
+        self, src: int, dst: int, profile: SpeedProfile, hour: int
+    ) -> Optional[Tuple[float, float, List[int]]]:
+        """A* on travel time; returns (length_m, duration_s, node path) or None."""
+        if src == dst:
+            return 0.0, 0.0, [src]
+        w = self._weights_for(profile, hour)
+        lat, lon, off, tgt = self.lat, self.lon, self.offsets, self.targets
+        # Admissible heuristic: straight-line distance at the fastest possible speed
+        vmax = self.max_speed_kmph * profile.max_multiplier() / 3.6
+        tlat = math.radians(lat[dst])
+        tlon = math.radians(lon[dst])
+
+        def h(n: int) -> float:
+            la = math.radians(lat[n])
+            x = (math.radians(lon[n]) - tlon) * math.cos((la + tlat) / 2.0)
+            y = la - tlat
+            return 0.995 * _EARTH_M * math.sqrt(x * x + y * y) / vmax
+
+        best: Dict[int, float] = {src: 0.0}
+        prev: Dict[int, Tuple[int, int]] = {}
+        heap: List[Tuple[float, float, int]] = [(h(src), 0.0, src)]
+        push, pop = heapq.heappush, heapq.heappop
+        while heap:
+            _, g, u = pop(heap)
+            if u == dst:
+                break
+            if g > best.get(u, math.inf):
+                continue
+            for e in range(off[u], off[u + 1]):
+                v = tgt[e]
+                ng = g + w[e]
+                if ng < best.get(v, math.inf):
+                    best[v] = ng
+                    prev[v] = (u, e)
+                    push(heap, (ng + h(v), ng, v))
+        else:
+            return None
+        path = [dst]
+        length = 0.0
+        node = dst
+        while node != src:
+            u, e = prev[node]
+            length += self.length_m[e]
+            path.append(u)
+            node = u
+        path.reverse()
+        return length, best[dst], path
+
+
+class _GraphBuilder:
+    """Deduplicates nodes by rounded coordinate while edges are added."""
+
+    def __init__(self, precision: int = 6):
+        self.precision = precision
+        self.index: Dict[Tuple[float, float], int] = {}
+        self.lats: List[float] = []
+        self.lons: List[float] = []
+        self.edges: List[Tuple[int, int, float, float, int]] = []
+
+    def node(self, lat: float, lon: float) -> int:
+        key = (round(lat, self.precision), round(lon, self.precision))
+        idx = self.index.get(key)
+        if idx is None:
+            idx = len(self.lats)
+            self.index[key] = idx
+            self.lats.append(key[0])
+            self.lons.append(key[1])
+        return idx
+
+    def add(self, a: Tuple[float, float], b: Tuple[float, float], speed: float, oneway: bool, cls: int) -> None:
+        u = self.node(*a)
+        v = self.node(*b)
+        if u == v:
+            return
+        length = haversine_km(a[0], a[1], b[0], b[1]) * 1000.0
+        self.edges.append((u, v, length, speed, cls))
+        if not oneway:
+            self.edges.append((v, u, length, speed, cls))
+
+    def build(self) -> RoadGraph:
+        return RoadGraph(self.lats, self.lons, self.edges)
+
+
+class LocalRoutingProvider:
+    """Maps provider backed by an in-process ``RoadGraph`` (no network)."""
+
+    def __init__(self, graph: RoadGraph, profile: Optional[SpeedProfile] = None, *, max_snap_km: Optional[float] = None):
+        self.graph = graph
+        self.profile = profile or SpeedProfile.default()
+        self.max_snap_km = float(max_snap_km if max_snap_km is not None else getattr(settings, "ROUTING_MAX_SNAP_KM", 1.0))
+        self.access_speed_kmph = max(1.0, float(getattr(settings, "AVG_SPEED_KMPH", 30.0)))
+        self.cache_ttl = max(0, int(getattr(settings, "MAPS_ROUTE_CACHE_SECS", 60)))
+        self._cache = BoundedTTLCache(
+            "taxi_local_routes",
+            maxsize=max(1, int(getattr(settings, "MAPS_ROUTE_CACHE_MAX_ENTRIES", 5000))),
+            ttl=max(1, self.cache_ttl),
+        )
+
+    def _hour(self, depart_at: Optional[datetime]) -> int:
+        tz_offset = int(getattr(settings, "ROUTING_TZ_OFFSET_HOURS", 3))
+        when = depart_at or datetime.now(timezone.utc)
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return (when.astimezone(timezone.utc).hour + tz_offset) % 24
+
+    def _leg(self, a: Tuple[float, float], b: Tuple[float, float], hour: int) -> Tuple[float, float, List[Tuple[float, float]]]:
+        """(km, seconds, polyline points) for one leg; haversine when off-graph."""
+        g = self.graph
+        s = g.nearest_node(a[0], a[1], self.max_snap_km)
+        t = g.nearest_node(b[0], b[1], self.max_snap_km)
+        res = g.shortest_path(s, t, self.profile, hour) if s is not None and t is not None else None
+        if res is None:
+            km = haversine_km(a[0], a[1], b[0], b[1])
+            return km, km / self.access_speed_kmph * 3600.0, [a, b]
+        length_m, secs, path = res
+        # Access/egress between the requested points and the snapped nodes
+        access_km = haversine_km(a[0], a[1], g.lat[s], g.lon[s]) + haversine_km(b[0], b[1], g.lat[t], g.lon[t])
+        pts = [a] + [(g.lat[n], g.lon[n]) for n in path] + [b]
+        return length_m / 1000.0 + access_km, secs + access_km / self.access_speed_kmph * 3600.0, pts
+
+    def route(
+        self, points: List[tuple[float, float]], want_polyline: bool = False, depart_at: Optional[datetime] = None
+    ) -> tuple[float, int, str | None]:
+        if len(points) < 2:
+            return 0.0, 1, None
+        hour = self._hour(depart_at)
+        cache_key = ("local", bool(want_polyline), hour, tuple((round(lat, 6), round(lon, 6)) for lat, lon in points))
+        if self.cache_ttl > 0:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+        dist_km = 0.0
+        secs = 0.0
+        poly_pts: List[Tuple[float, float]] = []
+        for a, b in zip(points, points[1:]):
+            km, s, pts = self._leg(a, b, hour)
+            dist_km += km
+            secs += s
+            if want_polyline:
+                poly_pts.extend(pts if not poly_pts else pts[1:])
+        mins = max(1, int(round(secs / 60.0)))
+        polyline = "|".join(f"{lat:.6f},{lon:.6f}" for lat, lon in poly_pts) if want_polyline else None
+        result = (dist_km, mins, polyline)
+        if self.cache_ttl > 0:
+            self._cache.set(cache_key, result)
+        return result
+
+    def eta_minutes(self, from_lat: float, from_lon: float, to_lat: float, to_lon: float) -> int:
+        _, mins, _ = self.route([(from_lat, from_lon), (to_lat, to_lon)], want_polyline=False)
+        return max(1, mins)
+
+    def route_distance_duration(self, points: List[tuple[float, float]]) -> tuple[float, int]:
+        dist_km, mins, _ = self.route(points, want_polyline=False)
+        return dist_km, mins
+
+
+def load_local_provider() -> LocalRoutingProvider:
+    """Build the provider from ROUTING_GRAPH_PATH / ROUTING_SPEED_PROFILE_PATH."""
+    path = getattr(settings, "ROUTING_GRAPH_PATH", None)
+    if not path:
+        raise RuntimeError("ROUTING_GRAPH_PATH must be set when MAPS_PROVIDER=local")
+    graph = RoadGraph.from_file(path)
+    profile_path = getattr(settings, "ROUTING_SPEED_PROFILE_PATH", None)
+    profile = SpeedProfile.from_file(profile_path) if profile_path else SpeedProfile.default()
+    return LocalRoutingProvider(graph, profile)
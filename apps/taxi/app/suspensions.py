@@ -0,0 +1,216 @@
+from __future__ import annotations
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from superapp_shared.cache import BoundedTTLCache
+from superapp_shared.redis_pool import get_redis
+
+from .config import settings
+from .database import SessionLocal
+from .models import Suspension
+
+
+log = logging.getLogger(__name__)
+
+USER = "user"
+DRIVER = "driver"
+_NOT_SUSPENDED = 0.0
+_INDEFINITE = float("inf")
+_EPOCH = datetime(1970, 1, 1)
+
+Subject = Tuple[str, str]
+
+
+def _utc_naive(dt: datetime) -> datetime:
+    # ``suspensions.until`` is a naive UTC timestamp
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _ts(dt: Optional[datetime]) -> float:
+    return _INDEFINITE if dt is None else (_utc_naive(dt) - _EPOCH).total_seconds()
+
+
+def _column(kind: str):
+    if kind == USER:
+        return Suspension.user_id
+    if kind == DRIVER:
+        return Suspension.driver_id
+    raise ValueError(f"unknown suspension subject {kind!r}")
+
+
+def _subjects(s: Suspension) -> List[Subject]:
+    out = []
+    if s.user_id:
+        out.append((USER, str(s.user_id)))
+    if s.driver_id:
+        out.append((DRIVER, str(s.driver_id)))
+    return out
+
+
+class SuspensionRegistry:
+    """Active rider/driver suspensions behind a per-subject cache.
+
+    A miss is one query on the partial ``ix_susp_*_active`` indexes returning the
+    latest ``until`` among the subject's active suspensions, however many
+    historical rows exist. The cache keeps that instant, so a time-bounded
+    suspension lapses on its own while cached. Changes made through ``suspend``,
+    ``set_active`` and ``lift`` drop the affected entries once their transaction
+    commits, here and (via Redis pub/sub) on the other replicas; ``cache_ttl``
+    bounds staleness for rows changed any other way.
+    """
+
+    def __init__(
+        self,
+        *,
+        cache_ttl: float = 30.0,
+        maxsize: int = 200_000,
+        redis_url: Optional[str] = None,
+        channel: str = "taxi:suspensions",
+        clock=time.time,
+    ):
+        self.cache = BoundedTTLCache("taxi_suspensions", maxsize=maxsize, ttl=cache_ttl)
+        self.clock = clock
+        self.channel = channel
+        self._redis = get_redis(redis_url, decode_responses=True) if redis_url else None
+        self._listener: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # -- reads -----------------------------------------------------------------
+
+    def suspended_until(self, db: Session, kind: str, subject_id) -> float:
+        """Epoch seconds the subject stays suspended (``inf`` = indefinitely, 0 = not suspended)."""
+        self._ensure_listener()
+        return self.cache.get_or_load((kind, str(subject_id)), lambda: self._load(db, kind, subject_id))
+
+    def is_suspended(self, db: Session, kind: str, subject_id) -> bool:
+        return self.suspended_until(db, kind, subject_id) > self.clock()
+
+    def _load(self, db: Session, kind: str, subject_id) -> float:
+        # Top of a backward scan on (subject, until): an indefinite suspension if any, else the
+        # latest end. One index probe however many lapsed rows the subject has; a past value
+        # simply means "not suspended".
+        row = db.execute(
+            select(Suspension.until)
+            .where(_column(kind) == subject_id, Suspension.active == True)  # noqa: E712  (partial index predicate)
+            .order_by(Suspension.until.desc().nulls_first())
+            .limit(1)
+        ).first()
+        return _NOT_SUSPENDED if row is None else _ts(row[0])
+
+    # -- writes ----------------------------------------------------------------
+
+    def suspend(self, db: Session, *, user_id=None, driver_id=None, reason: Optional[str] = None, minutes: Optional[int] = None) -> Suspension:
+        until = datetime.utcnow() + timedelta(minutes=minutes) if minutes and minutes > 0 else None
+        s = Suspension(user_id=user_id, driver_id=driver_id, reason=reason, until=until, active=True)
+        db.add(s)
+        db.flush()
+        self.invalidate_on_commit(db, _subjects(s))
+        return s
+
+    def set_active(self, db: Session, s: Suspension, active: bool) -> Suspension:
+        s.active = bool(active)
+        db.flush()
+        self.invalidate_on_commit(db, _subjects(s))
+        return s
+
+    def lift(self, db: Session, kind: str, subject_id) -> int:
+        """Deactivate every active suspension of one subject; returns the number lifted."""
+        n = db.execute(
+            update(Suspension)
+            .where(_column(kind) == subject_id, Suspension.active == True)  # noqa: E712
+            .values(active=False)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        self.invalidate_on_commit(db, [(kind, str(subject_id))])
+        return int(n or 0)
+
+    def expire_lapsed(self, db: Session, limit: int = 5000) -> int:
+        """Mark suspensions whose ``until`` has passed inactive so the active indexes stay small.
+
+        Lookups already ignore them, so no cache entry changes.
+        """
+        ids = (
+            select(Suspension.id)
+            .where(Suspension.active == True, Suspension.until.is_not(None), Suspension.until <= datetime.utcnow())  # noqa: E712
+            .limit(limit)
+            .scalar_subquery()
+        )
+        n = db.execute(update(Suspension).where(Suspension.id.in_(ids)).values(active=False).execution_options(synchronize_session=False)).rowcount
+        return int(n or 0)
+
+    # -- invalidation ----------------------------------------------------------
+
+    def invalidate_on_commit(self, db: Session, subjects: Iterable[Subject]) -> None:
+        db.info.setdefault("suspension_invalidations", set()).update(subjects)
+
+    def invalidate(self, subjects: Iterable[Subject], broadcast: bool = True) -> None:
+        subjects = [(k, str(i)) for k, i in subjects]
+        for key in subjects:
+            self.cache.delete(key)
+        if broadcast and subjects and self._redis is not None:
+            try:
+                self._redis.publish(self.channel, json.dumps(subjects))
+            except Exception:
+                log.warning("suspension invalidation publish failed; other replicas catch up within the cache TTL")
+
+    def _ensure_listener(self) -> None:
+        if self._redis is None or self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="suspension-invalidations", daemon=True)
+                self._listener.start()
+
+    def _listen(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                ps = self._redis.pubsub(ignore_subscribe_messages=True)
+                ps.subscribe(self.channel)
+                delay = 1.0
+                for msg in ps.listen():
+                    if msg.get("type") == "message":
+                        for kind, sid in json.loads(msg["data"]):
+                            self.cache.delete((kind, sid))
+            except Exception:
+                # Messages may have been missed while disconnected
+                self.cache.clear()
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+
+_registry: Optional[SuspensionRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> SuspensionRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                url = settings.REDIS_URL if settings.SUSPENSION_CACHE_BROADCAST else None
+                _registry = SuspensionRegistry(
+                    cache_ttl=settings.SUSPENSION_CACHE_TTL_SECS,
+                    maxsize=settings.SUSPENSION_CACHE_MAXSIZE,
+                    redis_url=url,
+                )
+    return _registry
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _invalidate_committed(session):
+    subjects = session.info.pop("suspension_invalidations", None)
+    if subjects:
+        get_registry().invalidate(subjects)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_invalidations(session):
+    session.info.pop("suspension_invalidations", None)
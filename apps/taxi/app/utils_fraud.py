@@ -1,9 +1,15 @@
 from __future__ import annotations
+import threading
+import uuid
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import List, Optional, Union
+from sqlalchemy import func, insert, select
 from sqlalchemy.orm import Session
 
-from .models import FraudEvent, Driver, DriverLocation, Ride, Suspension
+from superapp_shared.risk import DecisionRecorder, FeatureStore, RedisFeatureStore, RiskEngine, RiskEvent, RuleRegistry, feature_store_from_env, file_loader, mode_from_env
+
+from .models import FraudEvent, Driver, DriverLocation, Ride
+from .suspensions import DRIVER, USER, get_registry
 from .utils import haversine_km
 from .config import settings
 
@@ -20,25 +26,128 @@ def record_fraud_event(db: Session, *, user_id: Optional[str] = None, driver_id:
             pass
 
 
-def enforce_rider_velocity(db: Session, user_id: str) -> None:
+def default_risk_rules() -> dict:
+    """Built-in rider rules from the FRAUD_* settings; RISK_RULES_PATH overrides them."""
+    max_reqs = max(1, int(getattr(settings, "FRAUD_RIDER_MAX_REQUESTS", 6)))
+    window_rides = max(1, int(getattr(settings, "FRAUD_CANCEL_WINDOW_RIDES", 10)))
+    max_ratio = float(getattr(settings, "FRAUD_CANCEL_MAX_RATIO", 0.7))
+    return {
+        "version": f"builtin-{max_reqs}-{window_rides}-{max_ratio}",
+        "thresholds": {"flag": 60, "block": 100},
+        "rules": [
+            {"id": "rider_velocity", "when": f"context == 'ride_request' and rides_recent >= {max_reqs}", "action": "block", "reason": "too many ride requests"},
+            {
+                "id": "cancel_ratio",
+                "when": f"user.ride_request_count_24h >= {window_rides} and user.ride_cancel_count_24h / user.ride_request_count_24h > {max_ratio}",
+                "score": 60,
+                "reason": "high cancellation ratio",
+            },
+            {"id": "shared_device", "when": "device.users_24h > 5", "score": 30, "reason": "many riders on one device"},
+        ],
+    }
+
+
+def _write_decisions(items: List[dict]) -> None:
+    from .database import engine
+
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "user_id": uuid.UUID(d["subject"]) if d.get("subject") else None,
+            "driver_id": None,
+            "type": "risk.decision",
+            "data": d,
+            "created_at": datetime.utcfromtimestamp(d["ts"]),
+        }
+        for d in items
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(FraudEvent.__table__), rows)
+
+
+_risk_engine: Optional[RiskEngine] = None
+_risk_lock = threading.Lock()
+
+
+def get_risk_engine() -> RiskEngine:
+    global _risk_engine
+    if _risk_engine is None:
+        with _risk_lock:
+            if _risk_engine is None:
+                path = getattr(settings, "RISK_RULES_PATH", "") or ""
+                _risk_engine = RiskEngine(
+                    "taxi",
+                    RuleRegistry(
+                        file_loader(path) if path else None,
+                        fallback=default_risk_rules(),
+                        reload_secs=int(getattr(settings, "RISK_RULES_RELOAD_SECS", 10)),
+                    ),
+                    feature_store_from_env(settings.REDIS_URL, prefix="risk:taxi"),
+                    mode=mode_from_env(),
+                    recorder=DecisionRecorder(_write_decisions),
+                )
+    return _risk_engine
+
+
+def _velocity_window_secs() -> int:
     try:
-        window_secs = max(10, int(getattr(settings, "FRAUD_RIDER_WINDOW_SECS", 60)))
-        max_reqs = max(1, int(getattr(settings, "FRAUD_RIDER_MAX_REQUESTS", 6)))
+        return max(10, int(getattr(settings, "FRAUD_RIDER_WINDOW_SECS", 60)))
     except Exception:
-        window_secs, max_reqs = 60, 6
-    if max_reqs <= 0:
+        return 60
+
+
+_velocity_store: Union[FeatureStore, bool, None] = None
+
+
+def _velocity() -> Optional[FeatureStore]:
+    """Rolling ride-request counter per rider over FRAUD_RIDER_WINDOW_SECS, or None without a Redis feature store.
+
+    A per-process memory counter only sees the requests its own replica served,
+    so without Redis the check counts ``rides`` rows instead (ix_rides_rider_created).
+    """
+    global _velocity_store
+    if _velocity_store is None:
+        with _risk_lock:
+            if _velocity_store is None:
+                store = feature_store_from_env(settings.REDIS_URL, prefix="risk:taxi:velocity", windows={"velocity": _velocity_window_secs()})
+                _velocity_store = store if isinstance(store, RedisFeatureStore) else False
+    return _velocity_store or None
+
+
+def observe_ride_event(kind: str, user_id: str, *, amount_cents: int = 0, counterparty: Optional[str] = None) -> None:
+    """Feed a rider event (request/complete/cancel) into the rolling features (``user.ride_<kind>_count_24h``, ...)."""
+    ev = RiskEvent(f"ride_{kind}", user_id, amount_cents, counterparty=counterparty)
+    get_risk_engine().observe(ev)
+    store = _velocity()
+    if kind == "request" and store is not None:
+        store.observe(ev)
+
+
+def enforce_rider_velocity(db: Session, user_id: str) -> None:
+    window_secs = _velocity_window_secs()
+    store = _velocity()
+    if store is not None:
+        # Rides requested in the window, from the rolling counter fed by observe_ride_event("request")
+        cnt = int(store.features({"user": user_id}).get("user.ride_request_count_velocity", 0))
+    else:
+        since = datetime.utcnow() - timedelta(seconds=window_secs)
+        cnt = db.execute(select(func.count(Ride.id)).where(Ride.rider_user_id == user_id, Ride.created_at >= since)).scalar_one()
+    d = get_risk_engine().evaluate("ride_request", user_id=user_id, facts={"rides_recent": cnt, "window_secs": window_secs})
+    if d.flagged:
+        record_fraud_event(db, user_id=user_id, type="rider.risk_flag", data={"score": d.score, "factors": [h.rule for h in d.hits], "version": d.version})
+    if not d.blocked:
         return
-    since = datetime.now(timezone.utc) - timedelta(seconds=window_secs)
-    cnt = db.query(Ride).filter(Ride.rider_user_id == user_id).filter(Ride.created_at >= since).count()
-    if cnt >= max_reqs:
-        record_fraud_event(db, user_id=user_id, type="rider.velocity_block", data={"count": cnt, "window_secs": window_secs})
-        # Optional auto-suspension
-        if getattr(settings, "FRAUD_AUTOSUSPEND_ON_VELOCITY", False):
-            until = datetime.now(timezone.utc) + timedelta(minutes=max(1, int(getattr(settings, "FRAUD_AUTOSUSPEND_MINUTES", 10))))
-            susp = Suspension(user_id=user_id, reason="velocity", until=until, active=True)
-            db.add(susp); db.flush()
-        from fastapi import HTTPException, status
-        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many ride requests")
+    from fastapi import HTTPException, status
+    if not any(h.rule == "rider_velocity" for h in d.hits):
+        record_fraud_event(db, user_id=user_id, type="rider.risk_block", data={"score": d.score, "factors": [h.rule for h in d.hits], "version": d.version})
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="risk_blocked")
+    record_fraud_event(db, user_id=user_id, type="rider.velocity_block", data={"count": cnt, "window_secs": window_secs})
+    # Optional auto-suspension; own transaction, the request's is rolled back by the 429
+    if getattr(settings, "FRAUD_AUTOSUSPEND_ON_VELOCITY", False):
+        from .database import session_scope
+        with session_scope() as sdb:
+            get_registry().suspend(sdb, user_id=user_id, reason="velocity", minutes=max(1, int(getattr(settings, "FRAUD_AUTOSUSPEND_MINUTES", 10))))
+    raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many ride requests")
 
 
 def _get_driver_location(db: Session, driver_id: str) -> Optional[DriverLocation]:
@@ -66,16 +175,8 @@ def require_driver_location_fresh_and_near(db: Session, driver: Driver, *, targe
 
 
 def is_suspended_user(db: Session, user_id: str) -> bool:
-    from datetime import datetime, timezone
-    now = datetime.now(timezone.utc)
-    q = db.query(Suspension).filter(Suspension.user_id == user_id, Suspension.active == True)  # noqa: E712
-    rows = [s for s in q.all() if (s.until is None or s.until >= now)]
-    return len(rows) > 0
+    return get_registry().is_suspended(db, USER, user_id)
 
 
 def is_suspended_driver(db: Session, driver_id: str) -> bool:
-    from datetime import datetime, timezone
-    now = datetime.now(timezone.utc)
-    q = db.query(Suspension).filter(Suspension.driver_id == driver_id, Suspension.active == True)  # noqa: E712
-    rows = [s for s in q.all() if (s.until is None or s.until >= now)]
-    return len(rows) > 0
+    return get_registry().is_suspended(db, DRIVER, driver_id)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark the offline routing engine (app.routing).
+
+Usage:
+  python apps/taxi/scripts/bench_routing.py [--size 200] [--routes 500] [--graph path.osm|path.edges]
+
+Without --graph a synthetic city grid of size x size intersections (~110 m
+blocks, arterials every 10 blocks) is generated; 200x200 is ~40k nodes and
+~160k directed edges, roughly a Damascus-sized street network. Reports graph
+build time, snap time and routes/sec for random origin/destination pairs
+(route cache disabled so every query runs A*).
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+
+_HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(_HERE, ".."))
+sys.path.insert(0, os.path.join(_HERE, "..", "..", "..", "libs", "superapp_shared"))
+
+from app.routing import LocalRoutingProvider, RoadGraph, SpeedProfile, _GraphBuilder, _class_of  # type: ignore  # noqa: E402
+
+
+def synthetic_city(size: int, lat0: float = 33.45, lon0: float = 36.20, step: float = 0.001) -> RoadGraph:
+    b = _GraphBuilder()
+    for i in range(size):
+        for j in range(size):
+            here = (lat0 + i * step, lon0 + j * step)
+            if j + 1 < size:
+                arterial = i % 10 == 0
+                b.add(here, (lat0 + i * step, lon0 + (j + 1) * step), 60.0 if arterial else 30.0, False,
+                      _class_of("primary" if arterial else "residential"))
+            if i + 1 < size:
+                arterial = j % 10 == 0
+                b.add(here, (lat0 + (i + 1) * step, lon0 + j * step), 60.0 if arterial else 30.0, False,
+                      _class_of("primary" if arterial else "residential"))
+    return b.build()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size", type=int, default=200)
+    ap.add_argument("--routes", type=int, default=500)
+    ap.add_argument("--graph", default=None)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    graph = RoadGraph.from_file(args.graph) if args.graph else synthetic_city(args.size)
+    build_s = time.perf_counter() - t0
+    print(f"graph: nodes={graph.node_count} edges={graph.edge_count} build={build_s:.2f}s")
+
+    os.environ.setdefault("MAPS_ROUTE_CACHE_SECS", "0")
+    prov = LocalRoutingProvider(graph, SpeedProfile.default())
+    prov.cache_ttl = 0
+    rnd = random.Random(args.seed)
+    lats, lons = graph.lat, graph.lon
+    lo_lat, hi_lat, lo_lon, hi_lon = min(lats), max(lats), min(lons), max(lons)
+    pairs = [
+        ((rnd.uniform(lo_lat, hi_lat), rnd.uniform(lo_lon, hi_lon)), (rnd.uniform(lo_lat, hi_lat), rnd.uniform(lo_lon, hi_lon)))
+        for _ in range(args.routes)
+    ]
+
+    t0 = time.perf_counter()
+    for a, _ in pairs:
+        graph.nearest_node(a[0], a[1])
+    snap_s = time.perf_counter() - t0
+
+    # Warm per-hour edge weights once (done lazily on first query per hour)
+    prov.route([pairs[0][0], pairs[0][1]])
+    t0 = time.perf_counter()
+    total_km = 0.0
+    for a, b in pairs:
+        km, _, _ = prov.route([a, b])
+        total_km += km
+    route_s = time.perf_counter() - t0
+    print(f"snap: {args.routes / snap_s:,.0f} lookups/s")
+    print(f"routes: {args.routes} in {route_s:.2f}s -> {args.routes / route_s:,.1f} routes/s "
+          f"(avg {route_s / args.routes * 1000:.1f} ms, avg {total_km / args.routes:.1f} km)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Benchmark the suspension / rider-velocity checks on the ride-request path.
+
+Usage:
+  DB_URL=postgresql+psycopg2://... python apps/taxi/scripts/bench_suspensions.py \
+      [--rows 1000000] [--subjects 2000] [--steps 3] [--checks 2000] [--rides 200000]
+
+Seeds historical suspensions and fraud events in ``--steps`` stages growing
+tenfold up to ``--rows`` each (spread over ``--subjects`` riders, tagged with a
+per-run phone prefix). Most suspensions are lapsed rows still flagged active,
+as autosuspension leaves them, with ~1% of riders currently suspended. After
+each stage it times ``--checks`` lookups of random riders:
+
+  legacy  : load the rider's active suspensions and filter them in Python
+  indexed : SuspensionRegistry with a cold cache (one partial-index probe)
+  cached  : SuspensionRegistry with a warm cache
+
+and, once, the rider velocity count over ``--rides`` seeded rides (the old
+``COUNT`` over rides, used without a Redis feature store, vs the rolling
+counter, which needs ``REDIS_URL``). Seeded rows are left in place;
+use a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs", "superapp_shared"))
+os.environ.setdefault("RISK_FEATURE_BACKEND", "redis")
+
+if not os.getenv("DB_URL"):
+    print("Set DB_URL env to point to a scratch taxi database", file=sys.stderr)
+    sys.exit(2)
+
+from app import utils_fraud  # type: ignore  # noqa: E402
+from app.database import SessionLocal, engine  # type: ignore  # noqa: E402
+from app.models import Base, FraudEvent, Ride, Suspension, User  # type: ignore  # noqa: E402
+from app.suspensions import USER, SuspensionRegistry  # type: ignore  # noqa: E402
+
+
+def _legacy_is_suspended(db, user_id) -> bool:
+    """The check as it was before the registry: every active row of the rider, filtered in Python."""
+    now = datetime.utcnow()
+    q = db.query(Suspension).filter(Suspension.user_id == user_id, Suspension.active == True)  # noqa: E712
+    return any(s.until is None or s.until >= now for s in q.all())
+
+
+def _seed_subjects(tag: str, n: int) -> list:
+    now = datetime.utcnow()
+    ids = [uuid.uuid4() for _ in range(n)]
+    rows = [{"id": uid, "phone": f"+{tag}{i:07d}", "role": "rider", "created_at": now, "rider_loyalty_count": 0, "driver_loyalty_count": 0}
+            for i, uid in enumerate(ids)]
+    with engine.begin() as conn:
+        for i in range(0, len(rows), 5000):
+            conn.execute(insert(User.__table__), rows[i:i + 5000])
+    return ids
+
+
+def _seed_history(subjects: list, n: int, rnd: random.Random) -> None:
+    now = datetime.utcnow()
+    suspended = set(subjects[: max(1, len(subjects) // 100)])
+    with engine.begin() as conn:
+        for start in range(0, n, 20000):
+            susp, events = [], []
+            for _ in range(min(20000, n - start)):
+                uid = rnd.choice(subjects)
+                at = now - timedelta(minutes=rnd.randint(60, 60 * 24 * 365))
+                susp.append({
+                    "id": uuid.uuid4(), "user_id": uid, "reason": "velocity", "until": at + timedelta(minutes=10),
+                    "active": rnd.random() < 0.9, "created_at": at,
+                })
+                events.append({"id": uuid.uuid4(), "user_id": uid, "type": "rider.velocity_block", "data": {"count": 7}, "created_at": at})
+            conn.execute(insert(Suspension.__table__), susp)
+            conn.execute(insert(FraudEvent.__table__), events)
+        # Riders suspended right now: half indefinitely, half for another hour
+        conn.execute(insert(Suspension.__table__), [
+            {"id": uuid.uuid4(), "user_id": uid, "reason": "bench", "active": True, "created_at": now,
+             "until": None if i % 2 else now + timedelta(hours=1)}
+            for i, uid in enumerate(suspended)
+        ])
+
+
+def _seed_rides(subjects: list, n: int, rnd: random.Random) -> None:
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        for start in range(0, n, 20000):
+            rows = []
+            for _ in range(min(20000, n - start)):
+                # ~2% city-wide traffic inside the last minute, the rest history
+                recent = rnd.random() < 0.02
+                rows.append({
+                    "id": uuid.uuid4(), "rider_user_id": rnd.choice(subjects), "status": "completed",
+                    "pickup_lat": 33.51, "pickup_lon": 36.27, "dropoff_lat": 33.52, "dropoff_lon": 36.28,
+                    "quoted_fare_cents": 0, "escrow_released": False, "rider_reward_applied": False, "driver_reward_fee_waived": False,
+                    "created_at": now - (timedelta(seconds=rnd.randint(0, 59)) if recent else timedelta(minutes=rnd.randint(2, 60 * 24 * 90))),
+                })
+            conn.execute(insert(Ride.__table__), rows)
+
+
+def _time(fn, ids) -> float:
+    t0 = time.perf_counter()
+    for uid in ids:
+        fn(uid)
+    return (time.perf_counter() - t0) / len(ids) * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000, help="historical suspensions (and fraud events) at the last step")
+    ap.add_argument("--subjects", type=int, default=2000)
+    ap.add_argument("--steps", type=int, default=3)
+    ap.add_argument("--checks", type=int, default=2000)
+    ap.add_argument("--rides", type=int, default=200_000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    for idx in Suspension.__table__.indexes:
+        idx.create(bind=engine, checkfirst=True)
+    rnd = random.Random(args.seed)
+    tag = f"96399{uuid.uuid4().int % 10**2:02d}"
+    subjects = _seed_subjects(tag, args.subjects)
+    reg = SuspensionRegistry(cache_ttl=3600)
+    db = SessionLocal()
+
+    seeded = 0
+    sizes = [max(1, args.rows // 10 ** k) for k in reversed(range(args.steps))]
+    print(f"{'rows':>10} {'legacy us':>10} {'indexed us':>11} {'cached us':>10}")
+    for size in sizes:
+        t0 = time.perf_counter()
+        _seed_history(subjects, size - seeded, rnd)
+        seeded = size
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE suspensions"))
+            conn.execute(text("ANALYZE fraud_events"))
+        seed_secs = time.perf_counter() - t0
+        sample = [rnd.choice(subjects) for _ in range(args.checks)]
+        legacy = _time(lambda uid: _legacy_is_suspended(db, uid), sample)
+        db.expunge_all()
+
+        def cold(uid):
+            reg.cache.delete((USER, str(uid)))
+            return reg.is_suspended(db, USER, uid)
+
+        indexed = _time(cold, sample)
+        cached = _time(lambda uid: reg.is_suspended(db, USER, uid), sample)
+        mismatches = sum(_legacy_is_suspended(db, uid) != reg.is_suspended(db, USER, uid) for uid in sample[:200])
+        db.expunge_all()
+        print(f"{size:>10,} {legacy:>10.0f} {indexed:>11.0f} {cached:>10.1f}   (seeded in {seed_secs:.1f}s, mismatches={mismatches})")
+
+    plan = db.execute(text(
+        "EXPLAIN SELECT until FROM suspensions WHERE user_id = :u AND active ORDER BY until DESC NULLS FIRST LIMIT 1"
+    ), {"u": subjects[0]}).scalars().all()
+    print("plan    : " + " / ".join(p.strip() for p in plan[:2]))
+
+    if args.rides:
+        _seed_rides(subjects, args.rides, rnd)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE rides"))
+        sample = [rnd.choice(subjects) for _ in range(min(args.checks, 500))]
+        store = utils_fraud._velocity()
+        if store is None:
+            print("velocity: no Redis feature store (REDIS_URL); rolling counter skipped", file=sys.stderr)
+            db.close()
+            return
+        for uid in sample:
+            store.observe(utils_fraud.RiskEvent("ride_request", str(uid)))
+        since = datetime.utcnow() - timedelta(seconds=60)
+        counted = _time(lambda uid: db.execute(select(func.count(Ride.id)).where(Ride.rider_user_id == uid, Ride.created_at >= since)).scalar(), sample)
+        rolling = _time(lambda uid: store.features({"user": str(uid)}), sample)
+        print(f"velocity: COUNT over {args.rides:,} rides {counted:.0f} us/check, rolling counter {rolling:.1f} us/check")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Load test for the driver location ingestion pipeline (app.location_ingest).
+
+Usage:
+  python apps/taxi/scripts/load_location_ingest.py [--drivers 10000] [--seconds 10] [--threads 8]
+      [--flush-ms 500] [--sink-latency-ms 20] [--broker-latency-ms 0.05]
+
+Simulates ``--drivers`` drivers pinging from ``--threads`` request workers
+against a fake broker (per-message latency) and a fake DB sink (per-batch
+latency, i.e. one bulk upsert round trip). Reports accepted pings/s, p50/p99
+submit latency as seen by the request handler, and how many pings were
+coalesced vs. written. Compare with ``--legacy`` which models the old
+per-ping path: one broker connect + DB round trips on every request.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+_HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(_HERE, ".."))
+sys.path.insert(0, os.path.join(_HERE, "..", "..", "..", "libs", "superapp_shared"))
+
+from app.location_ingest import LocationIngestor, LocationPing, MqttPublisher  # type: ignore  # noqa: E402
+
+
+class FakeBroker:
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+        self.messages = 0
+        self.connects = 0
+
+    def reconnect_delay_set(self, **kw):
+        pass
+
+    def connect_async(self, *a, **kw):
+        self.connects += 1
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, body, qos=0, retain=False):
+        self.messages += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+
+class FakeSink:
+    def __init__(self, latency_s: float, active_every: int = 5):
+        self.latency_s = latency_s
+        self.rows = 0
+        self.batches = 0
+        self.active_every = active_every
+
+    def __call__(self, pings):
+        time.sleep(self.latency_s)
+        self.rows += len(pings)
+        self.batches += 1
+        return {p.driver_id: "ride-" + p.driver_id for p in pings if hash(p.driver_id) % self.active_every == 0}
+
+
+def _pct(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--drivers", type=int, default=10_000)
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--flush-ms", type=int, default=500)
+    ap.add_argument("--sink-latency-ms", type=float, default=20.0)
+    ap.add_argument("--broker-latency-ms", type=float, default=0.0)
+    ap.add_argument("--legacy", action="store_true", help="model the old per-ping connect + DB write")
+    args = ap.parse_args()
+
+    broker = FakeBroker(args.broker_latency_ms / 1000.0)
+    sink = FakeSink(args.sink_latency_ms / 1000.0)
+    ing = LocationIngestor(
+        sink=sink,
+        publisher=MqttPublisher("fake", client=broker),
+        interval_secs=args.flush_ms / 1000.0,
+        topic_prefix="taxi",
+    )
+    ing.start()
+
+    stop_at = time.perf_counter() + args.seconds
+    lat_by_thread: list[list[float]] = [[] for _ in range(args.threads)]
+
+    def worker(idx: int) -> None:
+        rnd = random.Random(idx)
+        lats = lat_by_thread[idx]
+        while time.perf_counter() < stop_at:
+            d = rnd.randrange(args.drivers)
+            t0 = time.perf_counter()
+            if args.legacy:
+                # connect + 2 DB round trips per ping, ~1ms each on a LAN
+                time.sleep(0.003)
+                broker.connects += 1
+            else:
+                ing.submit(LocationPing(f"d{d}", 33.5 + rnd.random() * 0.1, 36.3, datetime.now(timezone.utc)))
+            lats.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    ing.stop()
+
+    all_lat = sorted(v for part in lat_by_thread for v in part)
+    n = len(all_lat)
+    print(f"mode={'legacy' if args.legacy else 'batched'} drivers={args.drivers} threads={args.threads}")
+    print(f"pings: {n:,} in {elapsed:.1f}s -> {n / elapsed:,.0f} pings/s")
+    print(f"submit latency: p50={_pct(all_lat, 0.50) * 1e6:.0f}us p99={_pct(all_lat, 0.99) * 1e6:.0f}us")
+    if not args.legacy:
+        print(
+            f"coalesced={ing.stats['coalesced']:,} rows_written={sink.rows:,} batches={sink.batches} "
+            f"mqtt_msgs={broker.messages:,} broker_connects={broker.connects} errors={ing.stats['errors']}"
+        )
+    else:
+        print(f"broker_connects={broker.connects:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -46,3 +46,10 @@ def test_admin_unsuspend_user_allows_request():
     r = client.post("/rides/request", headers=ha, json={"pickup_lat":33.51, "pickup_lon":36.27, "dropoff_lat":33.52, "dropoff_lon":36.28})
     # may be requested or assigned
     assert r.status_code == 200
+
+
+def test_admin_ui_shows_payments_circuit_breaker():
+    r = client.get("/admin/ui", headers={"X-Admin-Token": os.environ["ADMIN_TOKEN"]})
+    assert r.status_code == 200
+    assert "Payments Circuit Breaker" in r.text and "/admin/payments/cb_reset" in r.text
+    assert r.text.rstrip().endswith("</body></html>")
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+import tracemalloc
+
+from superapp_shared.cache import BoundedTTLCache, cache_stats
+
+
+def test_lru_size_is_bounded_and_evictions_counted():
+    c = BoundedTTLCache("t_bound", maxsize=500, ttl=60)
+    for i in range(50_000):
+        c.set(i, {"v": i})
+    assert len(c) == 500
+    assert c.stats.evictions == 49_500
+    # Most recent keys survive, oldest are gone
+    assert c.get(49_999) == {"v": 49_999}
+    assert c.get(0) is None
+
+
+def test_memory_stays_flat_under_unique_keys():
+    c = BoundedTTLCache("t_mem", maxsize=1000, ttl=60)
+    for i in range(5_000):
+        c.set(f"warm-{i}", "x" * 100)
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    for i in range(100_000):
+        c.set(f"k-{i}", "x" * 100)
+    cur, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(c) == 1000
+    # Growth bounded by the working set, not by the 100k keys written
+    assert cur - base < 512 * 1024
+
+
+def test_expired_entries_are_evicted_on_write_not_only_on_read():
+    clock = [0.0]
+    c = BoundedTTLCache("t_exp", maxsize=10, ttl=1, clock=lambda: clock[0])
+    for i in range(10):
+        c.set(i, i)
+    clock[0] = 5.0
+    c.set("new", 1)
+    # Full cache reclaimed expired slots instead of evicting live entries
+    assert c.stats.expirations == 10
+    assert c.stats.evictions == 0
+    assert len(c) == 1
+    clock[0] = 10.0
+    assert c.purge_expired() == 1
+    assert len(c) == 0
+
+
+def test_tinylfu_keeps_hot_keys_under_scan():
+    c = BoundedTTLCache("t_lfu", maxsize=100, ttl=60, policy="tinylfu")
+    hot = [("hot", i) for i in range(20)]
+    for k in hot:
+        c.set(k, 1)
+    for i in range(20_000):
+        if i % 10 == 0:
+            for k in hot:
+                c.get(k)
+        if c.get(i) is None:
+            c.set(i, i)
+    assert all(k in c for k in hot)
+    assert len(c) <= 100
+
+
+def test_single_flight_and_negative_cache():
+    c = BoundedTTLCache("t_sf", maxsize=10, ttl=60, negative_ttl=60)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return "value"
+
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(c.get_or_load("k", slow))) for _ in range(25)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1 and out == ["value"] * 25
+    assert c.stats.coalesced == 24
+
+    misses = []
+    assert c.get_or_load("absent", lambda: misses.append(1)) is None
+    assert c.get_or_load("absent", lambda: misses.append(1)) is None
+    assert len(misses) == 1
+    assert c.stats.negative_hits == 1
+
+
+def test_stale_while_revalidate_serves_old_value_once():
+    clock = [0.0]
+    c = BoundedTTLCache("t_swr", maxsize=10, ttl=1, stale_ttl=30, clock=lambda: clock[0])
+    n = [0]
+
+    def load():
+        n[0] += 1
+        return n[0]
+
+    assert c.get_or_load("a", load) == 1
+    clock[0] = 2.0
+    assert c.get_or_load("a", load) == 1  # stale served, refresh kicked off
+    for _ in range(50):
+        if c.get("a") == 2:
+            break
+        time.sleep(0.01)
+    assert c.get_or_load("a", load) == 2
+    assert n[0] == 2
+
+
+def test_async_single_flight():
+    c = BoundedTTLCache("t_async", maxsize=10, ttl=60)
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 7
+
+    async def main():
+        return await asyncio.gather(*[c.aget_or_load("k", load) for _ in range(50)])
+
+    assert asyncio.run(main()) == [7] * 50
+    assert len(calls) == 1
+
+
+def test_route_cache_is_bounded(monkeypatch):
+    from app import maps
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "GOOGLE_MAPS_API_KEY", None, raising=False)
+    monkeypatch.setattr(settings, "MAPS_ROUTE_CACHE_MAX_ENTRIES", 50, raising=False)
+    prov = maps.GoogleMapsProvider()
+    for i in range(500):
+        prov.route([(33.5 + i * 1e-4, 36.3), (33.6, 36.4)])
+    assert len(prov._cache) == 50
+    snap = {s["name"]: s for s in cache_stats()}
+    assert snap["taxi_routes"]["evictions"] >= 450
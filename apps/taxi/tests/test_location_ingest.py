@@ -0,0 +1,142 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+from app.location_ingest import LocationIngestor, LocationPing, MqttPublisher
+
+
+class FakeSink:
+    def __init__(self, active=None, fail_times=0):
+        self.batches = []
+        self.active = active or {}
+        self.fail_times = fail_times
+
+    def __call__(self, pings):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise RuntimeError("db down")
+        self.batches.append(list(pings))
+        return {p.driver_id: self.active[p.driver_id] for p in pings if p.driver_id in self.active}
+
+
+class FakeClient:
+    def __init__(self):
+        self.connects = 0
+        self.published = []
+
+    def reconnect_delay_set(self, **kw):
+        pass
+
+    def connect_async(self, *a, **kw):
+        self.connects += 1
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, body, qos=0, retain=False):
+        self.published.append(topic)
+
+
+def _ts(sec=0):
+    return datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=sec)
+
+
+def _ingestor(sink, publisher=None, **kw):
+    return LocationIngestor(sink=sink, publisher=publisher, interval_secs=60, topic_prefix="taxi", autostart=False, **kw)
+
+
+def test_pings_coalesce_to_latest_per_driver():
+    sink = FakeSink()
+    ing = _ingestor(sink)
+    for i in range(5):
+        ing.submit(LocationPing("d1", 33.0 + i, 36.0, _ts(i)))
+    ing.submit(LocationPing("d1", 99.0, 99.0, _ts(-10)))  # late/out-of-order ping is dropped
+    ing.submit(LocationPing("d2", 34.0, 37.0, _ts(1)))
+    assert ing.flush() == 2
+    assert len(sink.batches) == 1
+    by_driver = {p.driver_id: p for p in sink.batches[0]}
+    assert by_driver["d1"].lat == 37.0
+    assert ing.stats["coalesced"] == 5
+
+
+def test_flush_respects_max_batch():
+    sink = FakeSink()
+    ing = _ingestor(sink, max_batch=100)
+    for i in range(250):
+        ing.submit(LocationPing(f"d{i}", 33.0, 36.0, _ts()))
+    assert ing.flush() == 250
+    assert [len(b) for b in sink.batches] == [100, 100, 50]
+
+
+def test_persistent_mqtt_client_and_ride_topics():
+    client = FakeClient()
+    pub = MqttPublisher("broker", client=client)
+    sink = FakeSink(active={"d1": "r1"})
+    ing = _ingestor(sink, publisher=pub)
+    for round_ in range(3):
+        ing.submit(LocationPing("d1", 33.0, 36.0, _ts(round_)))
+        ing.submit(LocationPing("d2", 33.0, 36.0, _ts(round_)))
+        ing.flush()
+    # One client for the process, not one connection per ping
+    assert pub._started
+    assert client.published.count("taxi/driver/d1/location") == 3
+    assert client.published.count("taxi/ride/r1/driver_location") == 3
+    assert not any("ride/" in t and "d2" in t for t in client.published)
+
+
+def test_sink_failure_requeues_without_clobbering_newer_ping():
+    sink = FakeSink(fail_times=1)
+    ing = _ingestor(sink)
+    ing.submit(LocationPing("d1", 1.0, 1.0, _ts(0)))
+    ing.submit(LocationPing("d2", 2.0, 2.0, _ts(0)))
+    ing.flush()
+    assert ing.stats["errors"] == 1 and not sink.batches
+    ing.submit(LocationPing("d1", 5.0, 5.0, _ts(5)))
+    ing.flush()
+    by_driver = {p.driver_id: p.lat for p in sink.batches[0]}
+    assert by_driver == {"d1": 5.0, "d2": 2.0}
+
+
+def test_sync_mode_ping_is_not_rewritten_but_is_broadcast():
+    sent = []
+    sink = FakeSink()
+
+    async def broadcaster(ride_id, payload):
+        sent.append((ride_id, payload["lat"]))
+
+    loop = asyncio.new_event_loop()
+    t = threading.Thread(target=loop.run_forever, daemon=True)
+    t.start()
+    try:
+        ing = _ingestor(sink, broadcaster=broadcaster)
+        ing.bind_loop(loop)
+        ing.submit(LocationPing("d1", 33.5, 36.3, _ts(), ride_id="r9", persist=False))
+        ing.flush()
+        # Flusher never blocks on the broadcast; drain the loop to observe it
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result(2)
+        assert sent == [("r9", 33.5)]
+        assert sink.batches[0][0].persist is False
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        t.join(2)
+
+
+def test_background_flusher_and_final_flush_on_stop():
+    sink = FakeSink()
+    ing = LocationIngestor(sink=sink, interval_secs=0.01)
+    ing.start()
+    ing.submit(LocationPing("d1", 1.0, 1.0, _ts()))
+    for _ in range(200):
+        if sink.batches:
+            break
+        threading.Event().wait(0.01)
+    assert sink.batches
+    ing.submit(LocationPing("d2", 1.0, 1.0, _ts()))
+    ing.stop()
+    assert any(p.driver_id == "d2" for b in sink.batches for p in b)
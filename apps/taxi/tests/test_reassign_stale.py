@@ -50,3 +50,21 @@ def test_reassign_stale_dev():
         body = r.json()
         assert "reassigned" in body and "scanned" in body
 
+
+
+def test_reassign_stale_job_is_scheduled_in_dev_only(monkeypatch):
+    from superapp_shared.scheduler import MemoryLeaseStore
+
+    from app.config import settings
+    from app.main import build_scheduler
+
+    monkeypatch.setattr(settings, "TAXI_REASSIGN_STALE_INTERVAL_SECS", 30)
+    monkeypatch.setattr(settings, "ENV", "prod")
+    assert not build_scheduler(store=MemoryLeaseStore(), synchronous=True).jobs["reassign_stale"].enabled
+    monkeypatch.setattr(settings, "ENV", "dev")
+    monkeypatch.setattr(settings, "TAXI_REASSIGN_STALE_MINUTES", 0)
+    sched = build_scheduler(store=MemoryLeaseStore(), synchronous=True)
+    assert sched.jobs["reassign_stale"].enabled
+    run = sched.run_now("reassign_stale")
+    assert run.status == "ok", run.error
+    assert "reassigned" in run.result and "scanned" in run.result
@@ -0,0 +1,118 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.routing import LocalRoutingProvider, RoadGraph, SpeedProfile
+from app.utils import haversine_km
+
+
+# A--B--C along a slow residential street, plus a fast primary detour A--D--C
+_EDGES = """
+# lat1,lon1,lat2,lon2,speed,oneway,class
+33.5000,36.3000,33.5000,36.3100,20,0,residential
+33.5000,36.3100,33.5000,36.3200,20,0,residential
+33.5000,36.3000,33.5050,36.3100,80,0,primary
+33.5050,36.3100,33.5000,36.3200,80,0,primary
+33.5000,36.3200,33.5000,36.3300,30,1,residential
+"""
+
+_OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="33.5000" lon="36.3000"/>
+  <node id="2" lat="33.5000" lon="36.3100"/>
+  <node id="3" lat="33.5000" lon="36.3200"/>
+  <node id="4" lat="33.6000" lon="36.4000"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/>
+    <tag k="highway" v="primary"/>
+    <tag k="oneway" v="yes"/>
+    <tag k="maxspeed" v="50"/>
+  </way>
+  <way id="11">
+    <nd ref="3"/><nd ref="4"/>
+    <tag k="waterway" v="river"/>
+  </way>
+</osm>
+"""
+
+
+@pytest.fixture()
+def graph(tmp_path):
+    p = tmp_path / "city.edges"
+    p.write_text(_EDGES)
+    return RoadGraph.from_file(str(p))
+
+
+def _night():
+    return datetime(2025, 1, 1, 0, 0, tzinfo=timezone.utc)  # 03:00 local
+
+
+def _rush():
+    return datetime(2025, 1, 1, 5, 0, tzinfo=timezone.utc)  # 08:00 local
+
+
+def test_edge_list_builds_csr_with_dedup(graph):
+    assert graph.node_count == 5
+    # 4 two-way edges + 1 one-way edge
+    assert graph.edge_count == 9
+
+
+def test_prefers_faster_road_and_reports_road_distance(graph):
+    prov = LocalRoutingProvider(graph, SpeedProfile())
+    dist_km, mins, poly = prov.route([(33.5, 36.30), (33.5, 36.32)], want_polyline=True, depart_at=_night())
+    straight = haversine_km(33.5, 36.30, 33.5, 36.32)
+    # Takes the primary detour via D: longer than straight line, but faster
+    assert dist_km > straight
+    assert "33.505000,36.310000" in poly
+    assert mins == 2
+
+
+def test_oneway_edges_respected(graph):
+    prov = LocalRoutingProvider(graph, SpeedProfile(), max_snap_km=0.2)
+    fwd = graph.shortest_path(graph.nearest_node(33.5, 36.32), graph.nearest_node(33.5, 36.33), prov.profile, 0)
+    back = graph.shortest_path(graph.nearest_node(33.5, 36.33), graph.nearest_node(33.5, 36.32), prov.profile, 0)
+    assert fwd is not None
+    assert back is None
+
+
+def test_rush_hour_profile_slows_eta(graph):
+    prov = LocalRoutingProvider(graph, SpeedProfile.default())
+    _, night, _ = prov.route([(33.5, 36.30), (33.5, 36.33)], depart_at=_night())
+    _, rush, _ = prov.route([(33.5, 36.30), (33.5, 36.33)], depart_at=_rush())
+    assert rush > night
+
+
+def test_off_graph_points_fall_back_to_haversine(graph):
+    prov = LocalRoutingProvider(graph, SpeedProfile(), max_snap_km=0.5)
+    dist_km, mins, _ = prov.route([(34.0, 37.0), (34.1, 37.1)])
+    assert dist_km == pytest.approx(haversine_km(34.0, 37.0, 34.1, 37.1))
+    assert mins >= 1
+
+
+def test_osm_xml_highways_only(tmp_path):
+    p = tmp_path / "tiny.osm"
+    p.write_text(_OSM)
+    g = RoadGraph.from_file(str(p))
+    assert g.node_count == 3
+    assert g.edge_count == 2  # oneway primary, river ignored
+    res = g.shortest_path(0, 2, SpeedProfile(), 12)
+    assert res is not None
+    length_m, secs, path = res
+    assert path == [0, 1, 2]
+    assert secs == pytest.approx(length_m / (50 / 3.6))
+
+
+def test_quote_uses_local_provider(monkeypatch, tmp_path):
+    p = tmp_path / "city.edges"
+    p.write_text(_EDGES)
+    from app import maps
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "MAPS_PROVIDER", "local", raising=False)
+    monkeypatch.setattr(settings, "ROUTING_GRAPH_PATH", str(p), raising=False)
+    monkeypatch.setattr(maps, "_provider", None)
+    prov = maps.get_maps_provider()
+    assert isinstance(prov, LocalRoutingProvider)
+    dist_km, mins = prov.route_distance_duration([(33.5, 36.30), (33.5, 36.32)])
+    assert dist_km > 0 and mins >= 1
+    monkeypatch.setattr(maps, "_provider", None)
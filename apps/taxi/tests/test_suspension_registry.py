@@ -0,0 +1,128 @@
+import os
+import random
+import time
+import uuid
+
+os.environ.setdefault("ADMIN_TOKEN", "admintest")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import utils_fraud  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import User  # noqa: E402
+from app.suspensions import DRIVER, USER, SuspensionRegistry, get_registry  # noqa: E402
+
+
+client = TestClient(app)
+ADMIN = {"X-Admin-Token": os.environ["ADMIN_TOKEN"].split(",")[0]}
+RIDE = {"pickup_lat": 33.51, "pickup_lon": 36.27, "dropoff_lat": 33.52, "dropoff_lon": 36.28}
+
+
+def _phone() -> str:
+    return "+9639" + "".join(random.choice("0123456789") for _ in range(8))
+
+
+def auth(phone: str, name: str = "Rider"):
+    client.post("/auth/request_otp", json={"phone": phone})
+    r = client.post("/auth/verify_otp", json={"phone": phone, "otp": "123456", "name": name})
+    assert r.status_code == 200
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _user_id(phone: str):
+    with SessionLocal() as db:
+        return db.query(User).filter(User.phone == phone).one().id
+
+
+def test_admin_changes_take_effect_immediately_despite_cache():
+    phone = _phone()
+    h = auth(phone)
+    uid = _user_id(phone)
+    reg = get_registry()
+    with SessionLocal() as db:
+        assert not reg.is_suspended(db, USER, uid)  # "not suspended" is now cached
+    r = client.post("/admin/suspensions", headers=ADMIN, json={"user_phone": phone, "reason": "abuse"})
+    assert r.status_code == 200 and r.json()["until"] is None
+    r = client.post("/rides/request", headers=h, json=RIDE)
+    assert r.status_code == 403 and r.json()["detail"] == "user_suspended"
+
+    active = client.get("/admin/suspensions/active", headers=ADMIN, params={"phone": phone}).json()["items"]
+    r = client.post(f"/admin/suspensions/{active[0]['id']}/toggle", headers=ADMIN, json={"active": False})
+    assert r.status_code == 200 and r.json()["active"] is False
+    assert client.post("/rides/request", headers=h, json=RIDE).status_code == 200
+
+
+def test_time_bounded_suspension_lapses_while_cached():
+    phone = _phone()
+    auth(phone)
+    uid = _user_id(phone)
+    now = [time.time()]
+    reg = SuspensionRegistry(cache_ttl=3600, clock=lambda: now[0])
+    with SessionLocal() as db:
+        reg.suspend(db, user_id=uid, reason="short", minutes=1)
+        reg.suspend(db, user_id=uid, reason="expired", minutes=None).active = False
+        db.commit()
+        until = reg.suspended_until(db, USER, uid)
+        assert abs(until - (now[0] + 60)) < 5 and reg.is_suspended(db, USER, uid)
+        now[0] += 61
+        assert not reg.is_suspended(db, USER, uid)  # same cache entry, no reload needed
+        assert reg.cache.stats.hits >= 2
+        assert not reg.is_suspended(db, DRIVER, uid)
+
+
+def test_invalidation_reaches_other_replicas():
+    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    channel = f"taxi:suspensions:test:{uuid.uuid4().hex[:8]}"
+    a = SuspensionRegistry(redis_url=redis_url, channel=channel, cache_ttl=3600)
+    b = SuspensionRegistry(redis_url=redis_url, channel=channel, cache_ttl=3600)
+    phone = _phone()
+    auth(phone)
+    uid = _user_id(phone)
+    with SessionLocal() as db:
+        assert not a.is_suspended(db, USER, uid)
+        time.sleep(0.3)  # let a's subscriber connect
+        b.suspend(db, user_id=uid, reason="fraud")
+        db.commit()
+        b.invalidate([(USER, uid)])
+        deadline = time.time() + 5
+        while not a.is_suspended(db, USER, uid) and time.time() < deadline:
+            time.sleep(0.05)
+        assert a.is_suspended(db, USER, uid)
+        assert b.lift(db, USER, uid) == 1
+        db.commit()
+
+
+def _three_requests(h):
+    codes = []
+    for _ in range(3):
+        r = client.post("/rides/request", headers=h, json=RIDE)
+        codes.append(r.status_code)
+        if r.status_code == 200:
+            # Finish the ride request so the next one is not rejected as a duplicate active ride
+            client.post(f"/rides/{r.json()['id']}/cancel_by_rider", headers=h)
+    return codes
+
+
+def test_rider_velocity_counts_rides_without_shared_store(monkeypatch):
+    monkeypatch.setattr(settings, "FRAUD_RIDER_MAX_REQUESTS", 2)
+    monkeypatch.setattr(settings, "FRAUD_RIDER_WINDOW_SECS", 60)
+    monkeypatch.setenv("RISK_FEATURE_BACKEND", "memory")
+    monkeypatch.setattr(utils_fraud, "_risk_engine", None)
+    monkeypatch.setattr(utils_fraud, "_velocity_store", None)
+    # A per-process counter would miss requests served by other replicas
+    assert utils_fraud._velocity() is None
+    assert _three_requests(auth(_phone())) == [200, 200, 429]
+
+
+def test_rider_velocity_uses_rolling_counter(monkeypatch):
+    monkeypatch.setattr(settings, "FRAUD_RIDER_MAX_REQUESTS", 2)
+    monkeypatch.setattr(settings, "FRAUD_RIDER_WINDOW_SECS", 60)
+    monkeypatch.setenv("RISK_FEATURE_BACKEND", "redis")
+    monkeypatch.setattr(utils_fraud, "_risk_engine", None)
+    monkeypatch.setattr(utils_fraud, "_velocity_store", None)
+    phone = _phone()
+    assert _three_requests(auth(phone)) == [200, 200, 429]
+    counts = utils_fraud._velocity().features({"user": str(_user_id(phone))})
+    assert counts["user.ride_request_count_velocity"] == 2
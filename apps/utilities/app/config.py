@@ -34,6 +34,14 @@ class Settings:
     OTP_TTL_SECS: int = int(os.getenv("OTP_TTL_SECS", "300"))
     OTP_MAX_ATTEMPTS: int = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
     DEV_DISABLE_OTP: bool = env_bool("DEV_DISABLE_OTP", default=False)
+    # Autopay engine (app/utils/autopay.py): job interval (0 disables), partitions, chunking and retries
+    AUTOPAY_POLL_SECS: int = int(os.getenv("AUTOPAY_POLL_SECS", "0"))
+    SCHEDULER_PARTITIONS: int = int(os.getenv("SCHEDULER_PARTITIONS", "4"))
+    AUTOPAY_CHUNK_SIZE: int = int(os.getenv("AUTOPAY_CHUNK_SIZE", "1000"))
+    AUTOPAY_CONCURRENCY: int = int(os.getenv("AUTOPAY_CONCURRENCY", "8"))
+    AUTOPAY_CATCHUP_DAYS: int = int(os.getenv("AUTOPAY_CATCHUP_DAYS", "3"))
+    AUTOPAY_MAX_ATTEMPTS: int = int(os.getenv("AUTOPAY_MAX_ATTEMPTS", "3"))
+    AUTOPAY_RETRY_SECS: int = int(os.getenv("AUTOPAY_RETRY_SECS", "3600"))
     # Internal API auth for orchestrators (e.g., AI Gateway)
     INTERNAL_API_SECRET: str = os.getenv("INTERNAL_API_SECRET", "dev_ai_secret")
 
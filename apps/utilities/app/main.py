@@ -27,6 +27,25 @@ from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_
 from .middleware_request_id import RequestIDMiddleware
 from .middleware_rate_limit import SlidingWindowLimiter
 from .middleware_rate_limit_redis import RedisRateLimiter
+from superapp_shared.scheduler import IntervalTrigger, Scheduler, install_scheduler, sql_partition_clause, store_from_env
+
+
+def build_scheduler(store=None, **kw) -> Scheduler:
+    """Scheduler running the system-wide autopay evaluation, one lease per partition of rules."""
+    from .models import AutoPayRule
+    from .utils.autopay import run_autopay
+
+    sched = Scheduler(store or store_from_env(engine, settings.REDIS_URL), service="utilities", **kw)
+
+    def _autopay(ctx):
+        return run_autopay(where=sql_partition_clause(AutoPayRule.id, ctx), check=ctx.check).to_dict()
+
+    secs = settings.AUTOPAY_POLL_SECS
+    sched.add_job(
+        "utilities_autopay", _autopay, IntervalTrigger(max(secs, 1)),
+        partitions=settings.SCHEDULER_PARTITIONS, lease_secs=max(60, secs * 3), enabled=secs > 0,
+    )
+    return sched
 
 
 def create_app() -> FastAPI:
@@ -75,6 +94,10 @@ def create_app() -> FastAPI:
     if settings.AUTO_CREATE_SCHEMA:
         Base.metadata.create_all(bind=engine)
 
+    if settings.AUTOPAY_POLL_SECS > 0:
+        # Every replica may run the job; partition leases keep each rule on one of them
+        install_scheduler(app, build_scheduler())
+
     @app.get("/health")
     def health():
         with engine.connect() as conn:
@@ -66,6 +66,9 @@ class BillerAccount(Base):
 
 class Bill(Base):
     __tablename__ = "bills"
+    __table_args__ = (
+        Index('ix_bills_account_status', 'account_id', 'status'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -143,5 +146,53 @@ class AutoPayRule(Base):
     account_id = Column(UUID(as_uuid=True), ForeignKey("biller_accounts.id"), nullable=False)
     day_of_month = Column(Integer, nullable=True)  # 1..28 (or None for due_date based)
     max_amount_cents = Column(Integer, nullable=True)  # cap per bill
+    period_cap_cents = Column(Integer, nullable=True)  # cap per calendar month across bills
     enabled = Column(Boolean, nullable=False, default=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=True)
+
+
+class AutoPayExecution(Base):
+    """One autopay decision per bill and period (YYYY-MM); the unique key is the idempotency guard."""
+
+    __tablename__ = "util_autopay_executions"
+    __table_args__ = (
+        UniqueConstraint('bill_id', 'period', name='uq_util_autopay_exec_bill_period'),
+        Index('ix_util_autopay_exec_rule_period', 'rule_id', 'period'),
+        Index('ix_util_autopay_exec_status', 'status', 'updated_at'),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    rule_id = Column(UUID(as_uuid=True), ForeignKey("util_autopay_rules.id"), nullable=False)
+    bill_id = Column(UUID(as_uuid=True), ForeignKey("bills.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    period = Column(String(7), nullable=False)
+    amount_cents = Column(Integer, nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending|paid|failed|skipped
+    reason = Column(String(64), nullable=True)
+    attempts = Column(Integer, nullable=False, default=1)
+    payment_ref = Column(String(64), nullable=True)
+    run_id = Column(UUID(as_uuid=True), nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class AutoPayAudit(Base):
+    """Append-only trail of autopay rule changes and per-bill outcomes."""
+
+    __tablename__ = "util_autopay_audit"
+    __table_args__ = (
+        Index('ix_util_autopay_audit_user', 'user_id', 'created_at'),
+        Index('ix_util_autopay_audit_run', 'run_id'),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=default_uuid)
+    run_id = Column(UUID(as_uuid=True), nullable=True)
+    rule_id = Column(UUID(as_uuid=True), nullable=True)
+    bill_id = Column(UUID(as_uuid=True), nullable=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    action = Column(String(16), nullable=False)  # rule_updated|paid|failed|skipped
+    amount_cents = Column(Integer, nullable=True)
+    reason = Column(String(64), nullable=True)
+    payment_ref = Column(String(64), nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
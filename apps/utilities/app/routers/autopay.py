@@ -1,14 +1,13 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
-from datetime import date
-import os
-import httpx
+from datetime import datetime
 
 from ..auth import get_current_user, get_db
-from ..models import User, BillerAccount, AutoPayRule, Bill
+from ..models import User, BillerAccount, AutoPayRule, AutoPayAudit
+from ..utils.autopay import record_rule_change, run_autopay
 
 
 router = APIRouter(prefix="/autopay", tags=["autopay"])
@@ -18,6 +17,7 @@ class AutoPayIn(BaseModel):
     account_id: str
     day_of_month: int | None = Field(default=None, ge=1, le=28, description="1..28 or None to use bill due_date")
     max_amount_cents: int | None = Field(default=None, ge=0)
+    period_cap_cents: int | None = Field(default=None, ge=0, description="Cap per calendar month across bills")
     enabled: bool = True
 
 
@@ -26,9 +26,29 @@ class AutoPayOut(BaseModel):
     account_id: str
     day_of_month: int | None
     max_amount_cents: int | None
+    period_cap_cents: int | None = None
     enabled: bool
 
 
+class AutoPayAuditOut(BaseModel):
+    id: str
+    run_id: str | None
+    rule_id: str | None
+    bill_id: str | None
+    action: str
+    amount_cents: int | None
+    reason: str | None
+    payment_ref: str | None
+    created_at: datetime
+
+
+def _to_out(r: AutoPayRule) -> AutoPayOut:
+    return AutoPayOut(
+        id=str(r.id), account_id=str(r.account_id), day_of_month=r.day_of_month, max_amount_cents=r.max_amount_cents,
+        period_cap_cents=r.period_cap_cents, enabled=r.enabled,
+    )
+
+
 @router.post("/rules", response_model=AutoPayOut)
 def upsert_rule(payload: AutoPayIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     acc = db.get(BillerAccount, payload.account_id)
@@ -40,42 +60,41 @@ def upsert_rule(payload: AutoPayIn, user: User = Depends(get_current_user), db:
         db.add(rule)
     rule.day_of_month = payload.day_of_month
     rule.max_amount_cents = payload.max_amount_cents
+    rule.period_cap_cents = payload.period_cap_cents
     rule.enabled = bool(payload.enabled)
+    rule.updated_at = datetime.utcnow()
     db.flush()
-    return AutoPayOut(id=str(rule.id), account_id=str(rule.account_id), day_of_month=rule.day_of_month, max_amount_cents=rule.max_amount_cents, enabled=rule.enabled)
+    record_rule_change(db, rule)
+    return _to_out(rule)
 
 
 @router.get("/rules", response_model=list[AutoPayOut])
 def list_rules(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     rows = db.query(AutoPayRule).filter(AutoPayRule.user_id == user.id).all()
-    return [AutoPayOut(id=str(r.id), account_id=str(r.account_id), day_of_month=r.day_of_month, max_amount_cents=r.max_amount_cents, enabled=r.enabled) for r in rows]
+    return [_to_out(r) for r in rows]
 
 
 @router.post("/run")
-def run_now(user: User = Depends(get_current_user), db: Session = Depends(get_db), authorization: str | None = Header(default=None, alias="Authorization")):
-    # For each enabled rule, if today matches (or bill is due today) and amount <= cap, trigger internal pay.
-    base = os.getenv("AI_GATEWAY_BASE_URL", "http://localhost:8099")
-    rules = db.query(AutoPayRule).filter(AutoPayRule.user_id == user.id, AutoPayRule.enabled == True).all()  # noqa: E712
-    ran = 0
-    for r in rules:
-        bills = db.query(Bill).filter(Bill.account_id == r.account_id, Bill.status == "pending").all()
-        for b in bills:
-            today = date.today()
-            match = False
-            if r.day_of_month:
-                match = today.day == r.day_of_month
-            else:
-                match = (b.due_date == today)
-            if not match:
-                continue
-            if r.max_amount_cents is not None and b.amount_cents > r.max_amount_cents:
-                continue
-            # Trigger local bill pay endpoint with the user's Authorization
-            try:
-                with httpx.Client(timeout=5.0) as client:
-                    r = client.post("http://localhost:8084/bills/%s/pay" % str(b.id), headers={"Authorization": authorization or ""})
-                    if r.status_code < 400:
-                        ran += 1
-            except Exception:
-                pass
-    return {"detail": "ok", "triggered": ran}
+def run_now(user: User = Depends(get_current_user)):
+    # Evaluate only this user's rules, in-process (same engine as the scheduled job)
+    report = run_autopay(where=AutoPayRule.user_id == user.id)
+    return {"detail": "ok", "triggered": report.paid_count, **report.to_dict()}
+
+
+@router.get("/audit", response_model=list[AutoPayAuditOut])
+def list_audit(limit: int = Query(default=50, ge=1, le=500), user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    rows = (
+        db.query(AutoPayAudit)
+        .filter(AutoPayAudit.user_id == user.id)
+        .order_by(AutoPayAudit.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        AutoPayAuditOut(
+            id=str(a.id), run_id=str(a.run_id) if a.run_id else None, rule_id=str(a.rule_id) if a.rule_id else None,
+            bill_id=str(a.bill_id) if a.bill_id else None, action=a.action, amount_cents=a.amount_cents, reason=a.reason,
+            payment_ref=a.payment_ref, created_at=a.created_at,
+        )
+        for a in rows
+    ]
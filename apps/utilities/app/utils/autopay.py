@@ -0,0 +1,468 @@
+"""Platform autopay for utilities bills.
+
+``/autopay/run`` used to loop over one user's rules, query bills per rule and
+call this service's own ``/bills/{id}/pay`` over HTTP with the user's bearer
+token. ``run_autopay`` instead evaluates rules system-wide (or for one user)
+in set-based chunks:
+
+- enabled rules are walked in id order, ``chunk_size`` at a time; one query
+  per chunk joins them to their account's pending bills that are due and
+  have no execution for the period (``YYYY-MM``) yet, along with what each
+  rule already spent this period,
+- a rule fires on ``day_of_month`` (or on the bill's ``due_date``) and up to
+  ``AUTOPAY_CATCHUP_DAYS`` later, so a missed run catches up,
+- per-bill (``max_amount_cents``) and per-period (``period_cap_cents``) caps
+  are applied in due order; a bill over a cap is recorded ``skipped``,
+- every decision is claimed by inserting its ``util_autopay_executions`` row
+  (unique per bill and period, ``ON CONFLICT DO NOTHING``) and committed
+  before any money moves, so overlapping runs never pay a bill twice,
+- payments execute in-process through a ``PaymentExecutor``; the default
+  signs Payments' ``/internal/transfer`` with the service's internal secret
+  and keys it ``util-autopay-<bill>-<period>``, so retrying a claim is
+  idempotent on the Payments side as well,
+- outcomes update executions and bills from one VALUES list per chunk and
+  are appended to ``util_autopay_audit``.
+
+Failed payments (and claims left ``pending`` by a crashed run) are retried
+after ``AUTOPAY_RETRY_SECS`` up to ``AUTOPAY_MAX_ATTEMPTS``; they keep their
+share of the period cap meanwhile.
+"""
+from __future__ import annotations
+
+import logging
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import Integer, String, and_, func, insert, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy.orm import Session
+
+from superapp_shared.bulk import unnest_rows
+
+from ..config import settings
+from ..database import SessionLocal
+from ..models import AutoPayAudit, AutoPayExecution, AutoPayRule, Bill, User
+
+
+log = logging.getLogger(__name__)
+
+CAP_STATUSES = ("paid", "pending", "failed")
+
+autopay_stats: Counter = Counter()
+
+
+def period_of(day: date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+@dataclass
+class Candidate:
+    rule_id: uuid.UUID
+    user_id: uuid.UUID
+    phone: str
+    bill_id: uuid.UUID
+    amount_cents: int
+    due_date: Optional[date]
+    max_amount_cents: Optional[int] = None
+    period_cap_cents: Optional[int] = None
+    spent_cents: int = 0
+    execution_id: Optional[uuid.UUID] = None
+
+    def idem_key(self, period: str) -> str:
+        return f"util-autopay-{self.bill_id}-{period}"
+
+
+@dataclass
+class PaymentOrder:
+    bill_id: uuid.UUID
+    user_phone: str
+    amount_cents: int
+    idem_key: str
+    reference: str
+
+
+@dataclass
+class PaymentResult:
+    ok: bool
+    ref: Optional[str] = None
+    reason: Optional[str] = None
+
+
+class PaymentExecutor:
+    """Moves the money for one bill; implementations must be thread-safe and idempotent per ``idem_key``."""
+
+    def pay(self, order: PaymentOrder) -> PaymentResult:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class PaymentsInternalExecutor(PaymentExecutor):
+    """Payer wallet -> bill issuer wallet via Payments ``/internal/transfer`` (HMAC-signed)."""
+
+    def __init__(self, base_url: str, secret: str, to_phone: str, timeout: float = 5.0):
+        self.secret = secret
+        self.to_phone = to_phone
+        self._client = httpx.Client(base_url=base_url, timeout=timeout)
+
+    def pay(self, order: PaymentOrder) -> PaymentResult:
+        from superapp_shared.internal_hmac import sign_internal_request_headers
+
+        payload = {"from_phone": order.user_phone, "to_phone": self.to_phone, "amount_cents": order.amount_cents}
+        headers = {**sign_internal_request_headers(payload, self.secret), "X-Idempotency-Key": order.idem_key}
+        try:
+            r = self._client.post("/internal/transfer", json=payload, headers=headers)
+        except httpx.HTTPError:
+            return PaymentResult(False, reason="payments_unreachable")
+        if r.status_code < 400:
+            return PaymentResult(True, ref=str(r.json().get("transfer_id") or "")[:64] or None)
+        try:
+            detail = str(r.json().get("detail") or "")
+        except ValueError:
+            detail = ""
+        if "insufficient" in detail.lower():
+            return PaymentResult(False, reason="insufficient_balance")
+        return PaymentResult(False, reason=f"payments_http_{r.status_code}")
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def default_executor() -> PaymentExecutor:
+    return PaymentsInternalExecutor(settings.PAYMENTS_BASE_URL, settings.PAYMENTS_INTERNAL_SECRET, settings.PAYMENTS_EBILL_ISSUER_PHONE)
+
+
+@dataclass
+class RunReport:
+    run_id: uuid.UUID = field(default_factory=uuid.uuid4)
+    period: str = ""
+    rules_scanned: int = 0
+    candidates: int = 0
+    claimed: int = 0
+    retried: int = 0
+    paid_count: int = 0
+    paid_cents: int = 0
+    skipped_count: int = 0
+    failed_count: int = 0
+    chunks: int = 0
+    reasons: Counter = field(default_factory=Counter)
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": str(self.run_id),
+            "period": self.period,
+            "rules_scanned": self.rules_scanned,
+            "candidates": self.candidates,
+            "claimed": self.claimed,
+            "retried": self.retried,
+            "paid_count": self.paid_count,
+            "paid_cents": self.paid_cents,
+            "skipped_count": self.skipped_count,
+            "failed_count": self.failed_count,
+            "chunks": self.chunks,
+            "reasons": dict(self.reasons),
+        }
+
+
+# -- evaluation -----------------------------------------------------------------
+
+
+def _rules_chunk(after: Optional[uuid.UUID], limit: int, where=None):
+    q = select(AutoPayRule).where(AutoPayRule.enabled == True)  # noqa: E712
+    if after is not None:
+        q = q.where(AutoPayRule.id > after)
+    if where is not None:
+        q = q.where(where)
+    return q.order_by(AutoPayRule.id).limit(limit).cte("r")
+
+
+def load_candidates(db: Session, today: date, after: Optional[uuid.UUID], limit: int, where=None, catchup_days: int = 0) -> Tuple[List[Candidate], Optional[uuid.UUID], int]:
+    """Due bills for the next ``limit`` enabled rules after ``after``; returns (candidates, last rule id, rules scanned)."""
+    period = period_of(today)
+    r = _rules_chunk(after, limit, where)
+    spent = (
+        select(AutoPayExecution.rule_id, func.sum(AutoPayExecution.amount_cents).label("cents"))
+        .where(AutoPayExecution.rule_id.in_(select(r.c.id)), AutoPayExecution.period == period, AutoPayExecution.status.in_(CAP_STATUSES))
+        .group_by(AutoPayExecution.rule_id)
+        .subquery("spent")
+    )
+    due = or_(
+        and_(r.c.day_of_month.isnot(None), r.c.day_of_month <= today.day, r.c.day_of_month + catchup_days >= today.day),
+        and_(r.c.day_of_month.is_(None), Bill.due_date.between(today - timedelta(days=catchup_days), today)),
+    )
+    claimed = select(AutoPayExecution.id).where(AutoPayExecution.bill_id == Bill.id, AutoPayExecution.period == period).exists()
+    # Rules without a due bill still come back (bill columns NULL) so the keyset advances in one statement
+    rows = db.execute(
+        select(
+            r.c.id, r.c.user_id, User.phone, Bill.id, Bill.amount_cents, Bill.due_date,
+            r.c.max_amount_cents, r.c.period_cap_cents, func.coalesce(spent.c.cents, 0),
+        )
+        .select_from(r)
+        .join(User, User.id == r.c.user_id)
+        .outerjoin(Bill, and_(Bill.account_id == r.c.account_id, Bill.user_id == r.c.user_id, Bill.status == "pending", due, ~claimed))
+        .outerjoin(spent, spent.c.rule_id == r.c.id)
+        .order_by(r.c.id, Bill.due_date.asc().nulls_last(), Bill.id)
+    ).all()
+    if not rows:
+        return [], None, 0
+    return [Candidate(*row) for row in rows if row[3] is not None], rows[-1][0], len({row[0] for row in rows})
+
+
+def decide(candidates: List[Candidate]) -> Tuple[List[Candidate], List[Tuple[Candidate, str]]]:
+    """Apply per-bill and per-period caps in due order; returns (to pay, [(skipped, reason)])."""
+    pay: List[Candidate] = []
+    skip: List[Tuple[Candidate, str]] = []
+    spent: Dict[uuid.UUID, int] = {}
+    for c in candidates:
+        so_far = spent.setdefault(c.rule_id, int(c.spent_cents or 0))
+        if c.max_amount_cents is not None and c.amount_cents > c.max_amount_cents:
+            skip.append((c, "over_bill_cap"))
+        elif c.period_cap_cents is not None and so_far + c.amount_cents > c.period_cap_cents:
+            skip.append((c, "over_period_cap"))
+        else:
+            spent[c.rule_id] = so_far + c.amount_cents
+            pay.append(c)
+    return pay, skip
+
+
+_UUID = UUID(as_uuid=True)
+_EXEC_COLS = (
+    ("id", _UUID), ("rule_id", _UUID), ("bill_id", _UUID), ("user_id", _UUID), ("amount_cents", Integer),
+    ("status", String), ("reason", String), ("attempts", Integer),
+)
+_AUDIT_COLS = (
+    ("rule_id", _UUID), ("bill_id", _UUID), ("user_id", _UUID), ("action", String),
+    ("amount_cents", Integer), ("reason", String), ("payment_ref", String),
+)
+
+
+def _audit(db: Session, report: RunReport, rows: List[tuple], now: datetime) -> None:
+    """Append audit rows ``(rule_id, bill_id, user_id, action, amount_cents, reason, payment_ref)``."""
+    if not rows:
+        return
+    src = unnest_rows("a", rows, *_AUDIT_COLS)
+    db.execute(insert(AutoPayAudit).from_select(
+        ["id", "run_id", *(c for c, _ in _AUDIT_COLS), "created_at"],
+        select(func.gen_random_uuid(), literal(report.run_id, _UUID), *src.c, literal(now)),
+    ))
+
+
+def _claim(db: Session, report: RunReport, pay: List[Candidate], skip: List[Tuple[Candidate, str]], now: datetime) -> List[Candidate]:
+    """Insert executions for this chunk's decisions; returns the bills this run now owns for payment."""
+    rows = []
+    for c in pay:
+        c.execution_id = uuid.uuid4()
+        rows.append((c.execution_id, c.rule_id, c.bill_id, c.user_id, c.amount_cents, "pending", None, 1))
+    for c, reason in skip:
+        rows.append((uuid.uuid4(), c.rule_id, c.bill_id, c.user_id, c.amount_cents, "skipped", reason, 0))
+    if not rows:
+        return []
+    src = unnest_rows("x", rows, *_EXEC_COLS)
+    got = set(db.execute(
+        pg_insert(AutoPayExecution.__table__)
+        .from_select(
+            [*(c for c, _ in _EXEC_COLS), "period", "run_id", "created_at", "updated_at"],
+            select(*src.c, literal(report.period), literal(report.run_id, _UUID), literal(now), literal(now)),
+        )
+        .on_conflict_do_nothing(constraint="uq_util_autopay_exec_bill_period")
+        .returning(AutoPayExecution.__table__.c.id)
+    ).scalars().all())
+    # Skips lost to a concurrent run are that run's to record
+    audit = []
+    for (c, reason), row in zip(skip, rows[len(pay):]):
+        if row[0] in got:
+            report.skipped_count += 1
+            report.reasons[reason] += 1
+            audit.append((c.rule_id, c.bill_id, c.user_id, "skipped", c.amount_cents, reason, None))
+    _audit(db, report, audit, now)
+    owned = [c for c in pay if c.execution_id in got]
+    report.claimed += len(owned)
+    return owned
+
+
+# -- execution ------------------------------------------------------------------
+
+
+def _execute(executor: PaymentExecutor, owned: List[Candidate], period: str, pool: Optional[ThreadPoolExecutor]) -> List[PaymentResult]:
+    def one(c: Candidate) -> PaymentResult:
+        order = PaymentOrder(c.bill_id, c.phone, c.amount_cents, c.idem_key(period), reference=f"autopay {c.bill_id}")
+        try:
+            return executor.pay(order)
+        except Exception:
+            log.exception("autopay payment for bill %s raised", c.bill_id)
+            return PaymentResult(False, reason="executor_error")
+
+    if pool is None or len(owned) < 2:
+        return [one(c) for c in owned]
+    return list(pool.map(one, owned))
+
+
+def _record(db: Session, report: RunReport, owned: List[Candidate], results: List[PaymentResult], now: datetime) -> None:
+    if not owned:
+        return
+    outcome = []
+    audit = []
+    paid_bills = []
+    for c, res in zip(owned, results):
+        status = "paid" if res.ok else "failed"
+        reason = None if res.ok else (res.reason or "failed")[:64]
+        ref = (res.ref or "")[:64] or None
+        outcome.append((c.execution_id, status, reason, ref))
+        audit.append((c.rule_id, c.bill_id, c.user_id, status, c.amount_cents, reason, ref))
+        if res.ok:
+            report.paid_count += 1
+            report.paid_cents += c.amount_cents
+            paid_bills.append((c.bill_id, ref))
+        else:
+            report.failed_count += 1
+            report.reasons[reason] += 1
+    v = unnest_rows("v", outcome, ("id", _UUID), ("status", String), ("reason", String), ("ref", String))
+    db.execute(
+        update(AutoPayExecution)
+        .where(AutoPayExecution.id == v.c.id)
+        .values(status=v.c.status, reason=v.c.reason, payment_ref=v.c.ref, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if paid_bills:
+        b = unnest_rows("b", paid_bills, ("id", _UUID), ("ref", String))
+        db.execute(
+            update(Bill)
+            .where(Bill.id == b.c.id, Bill.status == "pending")
+            .values(status="paid", payment_request_id=func.coalesce(b.c.ref, Bill.payment_request_id))
+            .execution_options(synchronize_session=False)
+        )
+    _audit(db, report, audit, now)
+
+
+def _claim_retries(db: Session, report: RunReport, now: datetime, where=None, limit: int = 1000) -> List[Candidate]:
+    """Re-claim failed (and abandoned pending) executions of this period whose retry delay passed."""
+    cutoff = now - timedelta(seconds=max(0, int(settings.AUTOPAY_RETRY_SECS)))
+    q = (
+        select(AutoPayExecution.id)
+        .join(Bill, Bill.id == AutoPayExecution.bill_id)
+        .join(AutoPayRule, AutoPayRule.id == AutoPayExecution.rule_id)
+        .where(
+            AutoPayExecution.period == report.period,
+            AutoPayExecution.status.in_(("failed", "pending")),
+            AutoPayExecution.attempts < max(1, int(settings.AUTOPAY_MAX_ATTEMPTS)),
+            AutoPayExecution.updated_at < cutoff,
+            Bill.status == "pending",
+            AutoPayRule.enabled == True,  # noqa: E712
+        )
+        .limit(limit)
+        .with_for_update(of=AutoPayExecution, skip_locked=True)
+    )
+    if where is not None:
+        q = q.where(where)
+    ids = db.execute(q).scalars().all()
+    if not ids:
+        return []
+    rows = db.execute(
+        update(AutoPayExecution)
+        .where(AutoPayExecution.id.in_(ids))
+        .values(status="pending", attempts=AutoPayExecution.attempts + 1, run_id=report.run_id, updated_at=now)
+        .returning(AutoPayExecution.id, AutoPayExecution.rule_id, AutoPayExecution.user_id, AutoPayExecution.bill_id, AutoPayExecution.amount_cents)
+        .execution_options(synchronize_session=False)
+    ).all()
+    phones = dict(db.execute(select(User.id, User.phone).where(User.id.in_({r.user_id for r in rows}))).all())
+    out = [Candidate(r.rule_id, r.user_id, phones.get(r.user_id, ""), r.bill_id, r.amount_cents, None, execution_id=r.id) for r in rows]
+    report.retried += len(out)
+    return out
+
+
+# -- run ------------------------------------------------------------------------
+
+
+def run_autopay(
+    *,
+    today: Optional[date] = None,
+    where=None,
+    executor: Optional[PaymentExecutor] = None,
+    chunk_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    check=None,
+    session_factory=SessionLocal,
+) -> RunReport:
+    """Evaluate enabled rules (optionally filtered by ``where`` on ``AutoPayRule``) and pay due bills.
+
+    ``check`` is called before claims are committed (scheduler lease fencing).
+    """
+    today = today or date.today()
+    report = RunReport(period=period_of(today))
+    chunk_size = max(1, int(chunk_size or settings.AUTOPAY_CHUNK_SIZE))
+    workers = max(1, int(concurrency or settings.AUTOPAY_CONCURRENCY))
+    own_executor = executor is None
+    executor = executor or default_executor()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="autopay") if workers > 1 else None
+    db = session_factory()
+    try:
+        def settle(owned: List[Candidate]) -> None:
+            results = _execute(executor, owned, report.period, pool)
+            # Money has moved: record outcomes even if the lease was lost meanwhile
+            _record(db, report, owned, results, datetime.utcnow())
+            db.commit()
+
+        # Retries first, so a bill retried this run is not also counted as new
+        while True:
+            retry = _claim_retries(db, report, datetime.utcnow(), where=where, limit=chunk_size)
+            if check:
+                check()
+            db.commit()
+            if not retry:
+                break
+            settle(retry)
+
+        after = None
+        while True:
+            cands, after, scanned = load_candidates(db, today, after, chunk_size, where, catchup_days=max(0, int(settings.AUTOPAY_CATCHUP_DAYS)))
+            if not scanned:
+                break
+            report.rules_scanned += scanned
+            report.candidates += len(cands)
+            report.chunks += 1
+            pay, skip = decide(cands)
+            owned = _claim(db, report, pay, skip, datetime.utcnow())
+            if check:
+                check()
+            db.commit()  # claims are durable before any money moves
+            if owned:
+                settle(owned)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+        if pool is not None:
+            pool.shutdown(wait=True)
+        if own_executor:
+            executor.close()
+    for k in ("rules_scanned", "claimed", "retried", "paid_count", "paid_cents", "skipped_count", "failed_count"):
+        autopay_stats[k] += getattr(report, k)
+    log.info("autopay run %s", report.to_dict())
+    return report
+
+
+def record_rule_change(db: Session, rule: AutoPayRule, period: Optional[str] = None) -> None:
+    """Audit a rule change and drop this period's cap skips so they are re-evaluated under the new caps."""
+    db.execute(
+        AutoPayExecution.__table__.delete().where(
+            AutoPayExecution.rule_id == rule.id,
+            AutoPayExecution.period == (period or period_of(date.today())),
+            AutoPayExecution.status == "skipped",
+        )
+    )
+    db.add(AutoPayAudit(
+        rule_id=rule.id,
+        user_id=rule.user_id,
+        action="rule_updated",
+        amount_cents=rule.max_amount_cents,
+        reason=("enabled" if rule.enabled else "disabled")
+        + (f";day={rule.day_of_month}" if rule.day_of_month else ";due_date")
+        + (f";period_cap={rule.period_cap_cents}" if rule.period_cap_cents is not None else ""),
+    ))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark the autopay engine over a large rule set.
+
+Usage:
+  DB_URL=postgresql+psycopg2://... python apps/utilities/scripts/bench_autopay.py \
+      [--rules 100000] [--bills-per-rule 1] [--chunk 1000] [--concurrency 8] [--legacy-sample 2000]
+
+Seeds ``--rules`` users, each with a linked account, an enabled rule and
+``--bills-per-rule`` pending bills due today (tagged with a per-run phone
+prefix), then runs ``run_autopay`` over exactly those rules with an in-memory
+payment executor. ``httpx.Client`` is replaced for the duration, so any call
+to an HTTP endpoint (this service's own ``/bills/{id}/pay`` included) aborts
+the run. Reports rules/s, SQL statements per rule, and checks that a second
+run pays nothing. ``--legacy-sample`` times the old per-rule evaluation
+(rule list + bills query per rule, HTTP call left out) for comparison.
+Seeded rows are left in place; use a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+from sqlalchemy import event, insert, select, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", "libs", "superapp_shared"))
+
+if not os.getenv("DB_URL"):
+    print("Set DB_URL env to point to a scratch utilities database", file=sys.stderr)
+    sys.exit(2)
+
+import httpx  # noqa: E402
+
+from app.database import SessionLocal, engine  # type: ignore  # noqa: E402
+from app.models import AutoPayRule, Base, Bill, Biller, BillerAccount, User  # type: ignore  # noqa: E402
+from app.utils import autopay  # type: ignore  # noqa: E402
+
+
+class _MemoryExecutor(autopay.PaymentExecutor):
+    def __init__(self):
+        self.paid = {}
+        self._lock = threading.Lock()
+
+    def pay(self, order):
+        with self._lock:
+            ref = self.paid.setdefault(order.idem_key, f"M{len(self.paid)}")
+        return autopay.PaymentResult(True, ref=ref)
+
+
+def _no_http(*a, **k):
+    raise RuntimeError("autopay benchmark must not make HTTP calls")
+
+
+def _seed(tag: str, base: int, rules: int, bills_per_rule: int) -> None:
+    now = datetime.utcnow()
+    today = date.today()
+    with engine.begin() as conn:
+        biller_id = conn.execute(select(Biller.id).limit(1)).scalar()
+        if biller_id is None:
+            biller_id = uuid.uuid4()
+            conn.execute(insert(Biller.__table__), [{"id": biller_id, "name": "Bench", "category": "electricity", "created_at": now}])
+        for start in range(0, rules, 5000):
+            users, accounts, rrows, brows = [], [], [], []
+            for i in range(start, min(rules, start + 5000)):
+                uid, aid = uuid.uuid4(), uuid.uuid4()
+                users.append({"id": uid, "phone": f"+{tag}{i:07d}", "name": "Bench", "created_at": now})
+                accounts.append({"id": aid, "user_id": uid, "biller_id": biller_id, "account_ref": f"B-{i}", "created_at": now})
+                rrows.append({"id": uuid.UUID(int=base + i), "user_id": uid, "account_id": aid, "max_amount_cents": 50_000, "enabled": True, "created_at": now})
+                for j in range(bills_per_rule):
+                    brows.append({
+                        "id": uuid.uuid4(), "user_id": uid, "biller_id": biller_id, "account_id": aid,
+                        "amount_cents": 1000 + (i + j) % 5000, "status": "pending", "due_date": today, "created_at": now,
+                    })
+            conn.execute(insert(User.__table__), users)
+            conn.execute(insert(BillerAccount.__table__), accounts)
+            conn.execute(insert(AutoPayRule.__table__), rrows)
+            conn.execute(insert(Bill.__table__), brows)
+
+
+def _legacy(user_ids) -> None:
+    """The per-user evaluation ``/autopay/run`` used to do, minus its HTTP call per bill."""
+    today = date.today()
+    db = SessionLocal()
+    try:
+        for uid in user_ids:
+            rules = db.query(AutoPayRule).filter(AutoPayRule.user_id == uid, AutoPayRule.enabled == True).all()  # noqa: E712
+            for r in rules:
+                for b in db.query(Bill).filter(Bill.account_id == r.account_id, Bill.status == "pending").all():
+                    _ = (r.day_of_month == today.day) if r.day_of_month else (b.due_date == today)
+    finally:
+        db.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rules", type=int, default=100_000)
+    ap.add_argument("--bills-per-rule", type=int, default=1)
+    ap.add_argument("--chunk", type=int, default=1000)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--legacy-sample", type=int, default=2000)
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    tag = f"96398{uuid.uuid4().int % 10**5:05d}"
+    # Seeded rule ids share a random 64-bit prefix, so the run is scoped by a primary-key range
+    base = (uuid.uuid4().int >> 64) << 64
+    t0 = time.perf_counter()
+    _seed(tag, base, args.rules, args.bills_per_rule)
+    with engine.begin() as conn:
+        for t in ("users", "biller_accounts", "util_autopay_rules", "bills"):
+            conn.execute(text(f"ANALYZE {t}"))
+    print(f"seeded {args.rules:,} rules / {args.rules * args.bills_per_rule:,} bills in {time.perf_counter() - t0:.1f}s")
+
+    statements = [0]
+
+    def _count(*a, **k):
+        statements[0] += 1
+
+    event.listen(engine, "before_cursor_execute", _count)
+    scope = AutoPayRule.id.between(uuid.UUID(int=base), uuid.UUID(int=base + args.rules - 1))
+    ex = _MemoryExecutor()
+    real_client, httpx.Client = httpx.Client, _no_http  # type: ignore[assignment]
+    try:
+        t0 = time.perf_counter()
+        rep = autopay.run_autopay(where=scope, executor=ex, chunk_size=args.chunk, concurrency=args.concurrency)
+        secs = time.perf_counter() - t0
+        stmts, statements[0] = statements[0], 0
+        again = autopay.run_autopay(where=scope, executor=ex, chunk_size=args.chunk, concurrency=args.concurrency)
+    finally:
+        httpx.Client = real_client  # type: ignore[assignment]
+    print(
+        f"engine  : {rep.rules_scanned:,} rules in {secs:.1f}s ({rep.rules_scanned / max(secs, 1e-9):,.0f} rules/s), "
+        f"{rep.paid_count:,} paid / {rep.skipped_count:,} skipped / {rep.failed_count:,} failed, "
+        f"{rep.chunks} chunks, {stmts:,} SQL statements ({stmts / max(rep.rules_scanned, 1):.3f} per rule)"
+    )
+    print(f"rerun   : {again.paid_count} paid, {again.candidates} candidates, {statements[0]} SQL statements")
+    event.remove(engine, "before_cursor_execute", _count)
+    assert rep.paid_count == args.rules * args.bills_per_rule and again.paid_count == 0 and len(ex.paid) == rep.paid_count
+
+    if args.legacy_sample:
+        with engine.connect() as conn:
+            sample = conn.execute(select(User.id).where(User.phone.like(f"+{tag}%")).limit(args.legacy_sample)).scalars().all()
+        t0 = time.perf_counter()
+        _legacy(sample)
+        secs = time.perf_counter() - t0
+        print(f"legacy  : {len(sample):,} users in {secs:.1f}s ({len(sample) / max(secs, 1e-9):,.0f} rules/s, 2 queries per rule, no payment)")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,13 @@ from .internal_hmac import (
     verify_internal_hmac_with_replay,
 )
 from .env import env_bool, env_list
+from .redis_pool import (
+    RedisClientRegistry,
+    get_redis,
+    get_async_redis,
+    redis_pool_stats,
+    install_redis_lifecycle,
+)
 from .phone_utils import normalize_phone_e164, mask_phone
 
 __all__ = [
@@ -37,6 +44,11 @@ __all__ = [
     "canonical_json",
     "sign_internal_request_headers",
     "verify_internal_hmac_with_replay",
+    "RedisClientRegistry",
+    "get_redis",
+    "get_async_redis",
+    "redis_pool_stats",
+    "install_redis_lifecycle",
     "env_bool",
     "env_list",
     "normalize_phone_e164",
@@ -0,0 +1,32 @@
+"""
+Set-based bulk writes for Postgres.
+
+Batch jobs (ledger campaigns, voucher issuance, utilities autopay) write
+thousands of rows per statement. Binding every value as its own parameter
+makes the statement text and its parameter list grow with the batch; with
+``unnest`` each column is bound as one array instead:
+
+- ``unnest_rows(name, rows, *cols)``: ``rows`` (tuples, in ``cols`` order) as
+  a derived table ``name`` with one typed column per ``(column name, type)``,
+  so a 5000-row write compiles like a 1-row one. Use it as the source of
+  ``INSERT ... SELECT`` or as the ``FROM`` of an ``UPDATE``.
+
+Usage::
+
+    from superapp_shared.bulk import unnest_rows
+
+    v = unnest_rows("v", [(id1, 5), (id2, -3)], ("id", UUID(as_uuid=True)), ("delta", Integer))
+    db.execute(update(Wallet).where(Wallet.id == v.c.id).values(balance_cents=Wallet.balance_cents + v.c.delta))
+"""
+from __future__ import annotations
+
+from typing import Any, Sequence, Tuple
+
+
+def unnest_rows(name: str, rows: Sequence[tuple], *cols: Tuple[str, Any]):
+    """Rows as ``unnest(array, ...) AS name(col, ...)``: one bound array per column."""
+    from sqlalchemy import cast, column, func, literal  # type: ignore
+    from sqlalchemy.dialects.postgresql import ARRAY  # type: ignore
+
+    arrays = [cast(literal([r[i] for r in rows], ARRAY(t)), ARRAY(t)) for i, (_, t) in enumerate(cols)]
+    return func.unnest(*arrays).table_valued(*[column(c, t) for c, t in cols]).render_derived(name=name)
@@ -0,0 +1,550 @@
+"""
+Bounded, instrumented in-process caches.
+
+Replaces the hand-rolled ``dict`` caches that grew without bound and only
+evicted on read. Every cache here has a hard ``maxsize`` and evicts on write.
+
+- ``BoundedTTLCache``: LRU or TinyLFU-admission TTL cache, safe to share
+  between threads and asyncio tasks (locks are never held across awaits).
+- ``get_or_load`` / ``aget_or_load``: single-flight loading (concurrent
+  misses for one key run the loader once), negative caching of ``None``
+  results and stale-while-revalidate.
+- ``TwoTierCache``: local L1 in front of a shared Redis L2.
+- ``cache_stats()``: hit/miss/eviction counters for every named cache, also
+  exported as ``cache_*`` Prometheus metrics via ``register_prometheus_collector``.
+
+Usage::
+
+    from superapp_shared.cache import BoundedTTLCache
+
+    _routes = BoundedTTLCache("taxi_routes", maxsize=5000, ttl=60)
+    val = _routes.get_or_load(key, lambda: compute(key))
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .redis_pool import get_redis
+
+
+_MISSING = object()
+
+
+class _Negative:
+    """Marker stored for negatively cached keys (loader returned None)."""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return "<negative>"
+
+
+NEGATIVE = _Negative()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stale_hits: int = 0
+    negative_hits: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    rejections: int = 0
+    loads: int = 0
+    load_errors: int = 0
+    coalesced: int = 0
+    l2_hits: int = 0
+    l2_misses: int = 0
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return (self.hits / total) if total else 0.0
+
+
+@dataclass
+class _Entry:
+    value: Any
+    expires_at: float
+    stale_until: float
+    refreshing: bool = field(default=False)
+
+
+class _FrequencySketch:
+    """4-row count-min sketch with periodic halving (TinyLFU aging)."""
+
+    _SEEDS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)
+
+    def __init__(self, capacity: int):
+        width = 16
+        while width < max(16, capacity * 4):
+            width <<= 1
+        self._mask = width - 1
+        self._rows = [[0] * width for _ in self._SEEDS]
+        self._additions = 0
+        self._sample = max(64, capacity * 10)
+
+    def _indexes(self, key: Hashable):
+        h = hash(key)
+        for seed in self._SEEDS:
+            yield ((h ^ seed) * 0x01000193) & self._mask
+
+    def add(self, key: Hashable) -> None:
+        for row, idx in zip(self._rows, self._indexes(key)):
+            if row[idx] < 15:
+                row[idx] += 1
+        self._additions += 1
+        if self._additions >= self._sample:
+            self._additions //= 2
+            for row in self._rows:
+                for i, v in enumerate(row):
+                    if v:
+                        row[i] = v >> 1
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[idx] for row, idx in zip(self._rows, self._indexes(key)))
+
+
+_REGISTRY: "weakref.WeakValueDictionary[str, BoundedTTLCache]" = weakref.WeakValueDictionary()
+_REGISTRY_LOCK = threading.Lock()
+
+
+class BoundedTTLCache:
+    """Size-bounded TTL cache with LRU or TinyLFU eviction.
+
+    ``ttl`` is the default freshness window in seconds; ``stale_ttl`` adds an
+    extra window in which ``get_or_load`` serves the old value while one
+    background refresh runs. ``negative_ttl`` caches ``None`` loader results.
+    """
+
+    def __init__(
+        self,
+        name: str = "",
+        *,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        stale_ttl: float = 0.0,
+        negative_ttl: float = 0.0,
+        policy: str = "lru",
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        policy = (policy or "lru").lower()
+        if policy not in ("lru", "tinylfu"):
+            raise ValueError(f"Unknown cache policy {policy!r}")
+        self.name = name or f"cache-{id(self):x}"
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self.stale_ttl = float(stale_ttl)
+        self.negative_ttl = float(negative_ttl)
+        self.policy = policy
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._sketch = _FrequencySketch(self.maxsize) if policy == "tinylfu" else None
+        self._inflight: Dict[Hashable, "_Flight"] = {}
+        self._ainflight: Dict[Tuple[int, Hashable], "asyncio.Future[Any]"] = {}
+        self.stats = CacheStats()
+        with _REGISTRY_LOCK:
+            _REGISTRY[self.name] = self
+
+    # -- basic mapping API -------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key, count=False)[0] is not _MISSING
+
+    def _lookup(self, key: Hashable, *, count: bool = True, allow_stale: bool = False) -> Tuple[Any, bool]:
+        """Return (value-or-_MISSING, is_stale)."""
+        now = self._clock()
+        with self._lock:
+            if self._sketch is not None and count:
+                self._sketch.add(key)
+            ent = self._data.get(key)
+            if ent is None:
+                if count:
+                    self.stats.misses += 1
+                return _MISSING, False
+            if ent.expires_at > now:
+                self._data.move_to_end(key)
+                if count:
+                    self.stats.hits += 1
+                    if ent.value is NEGATIVE:
+                        self.stats.negative_hits += 1
+                return ent.value, False
+            if allow_stale and ent.stale_until > now:
+                self._data.move_to_end(key)
+                if count:
+                    self.stats.stale_hits += 1
+                return ent.value, True
+            del self._data[key]
+            self.stats.expirations += 1
+            if count:
+                self.stats.misses += 1
+            return _MISSING, False
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value, _ = self._lookup(key)
+        if value is _MISSING or value is NEGATIVE:
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl_val = self.ttl if ttl is None else float(ttl)
+        if ttl_val <= 0:
+            return
+        now = self._clock()
+        stale = self.stale_ttl if value is not NEGATIVE else 0.0
+        ent = _Entry(value=value, expires_at=now + ttl_val, stale_until=now + ttl_val + stale)
+        with self._lock:
+            if key in self._data:
+                self._data[key] = ent
+                self._data.move_to_end(key)
+                return
+            if len(self._data) >= self.maxsize:
+                self._purge_expired(now, limit=8)
+            if len(self._data) >= self.maxsize:
+                victim = next(iter(self._data))
+                if self._sketch is not None and self._sketch.estimate(key) <= self._sketch.estimate(victim):
+                    # TinyLFU admission: the newcomer is colder than the LRU victim
+                    self.stats.rejections += 1
+                    return
+                del self._data[victim]
+                self.stats.evictions += 1
+            self._data[key] = ent
+
+    def set_negative(self, key: Hashable, ttl: Optional[float] = None) -> None:
+        self.set(key, NEGATIVE, self.negative_ttl if ttl is None else ttl)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    # Alias used by callers that treat the cache as an invalidation target
+    invalidate = delete
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def _purge_expired(self, now: float, limit: Optional[int] = None) -> int:
+        # Oldest entries sit at the front; stop after ``limit`` live entries
+        dead: List[Hashable] = []
+        checked = 0
+        for key, ent in self._data.items():
+            if ent.stale_until <= now:
+                dead.append(key)
+            else:
+                checked += 1
+                if limit is not None and checked >= limit:
+                    break
+        for key in dead:
+            del self._data[key]
+        self.stats.expirations += len(dead)
+        return len(dead)
+
+    def purge_expired(self) -> int:
+        """Drop every fully expired entry; returns the number removed."""
+        with self._lock:
+            return self._purge_expired(self._clock())
+
+    # -- loading -----------------------------------------------------------
+
+    def _store_loaded(self, key: Hashable, value: Any, ttl: Optional[float]) -> None:
+        if value is None:
+            if self.negative_ttl > 0:
+                self.set_negative(key)
+        else:
+            self.set(key, value, ttl)
+
+    def _mark_refreshing(self, key: Hashable) -> bool:
+        with self._lock:
+            ent = self._data.get(key)
+            if ent is None or ent.refreshing:
+                return False
+            ent.refreshing = True
+            return True
+
+    def _clear_refreshing(self, key: Hashable) -> None:
+        with self._lock:
+            ent = self._data.get(key)
+            if ent is not None:
+                ent.refreshing = False
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Return the cached value or run ``loader`` once across concurrent callers."""
+        value, is_stale = self._lookup(key, allow_stale=self.stale_ttl > 0)
+        if value is not _MISSING:
+            if is_stale and self._mark_refreshing(key):
+                threading.Thread(target=self._refresh, args=(key, loader, ttl), daemon=True).start()
+            return None if value is NEGATIVE else value
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+            else:
+                self.stats.coalesced += 1
+        if not leader:
+            return flight.wait()
+        try:
+            self.stats.loads += 1
+            result = loader()
+        except BaseException as exc:
+            self.stats.load_errors += 1
+            flight.fail(exc)
+            raise
+        else:
+            self._store_loaded(key, result, ttl)
+            flight.done(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float]) -> None:
+        try:
+            self.stats.loads += 1
+            self._store_loaded(key, loader(), ttl)
+        except Exception:
+            self.stats.load_errors += 1
+            self._clear_refreshing(key)
+
+    async def aget_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: Optional[float] = None
+    ) -> Any:
+        """Async variant of ``get_or_load``; coalesces per event loop."""
+        value, is_stale = self._lookup(key, allow_stale=self.stale_ttl > 0)
+        if value is not _MISSING:
+            if is_stale and self._mark_refreshing(key):
+                asyncio.ensure_future(self._arefresh(key, loader, ttl))
+            return None if value is NEGATIVE else value
+        loop = asyncio.get_running_loop()
+        fkey = (id(loop), key)
+        fut = self._ainflight.get(fkey)
+        if fut is not None:
+            self.stats.coalesced += 1
+            return await asyncio.shield(fut)
+        fut = loop.create_future()
+        self._ainflight[fkey] = fut
+        try:
+            self.stats.loads += 1
+            result = await loader()
+        except BaseException as exc:
+            self.stats.load_errors += 1
+            if not fut.done():
+                fut.set_exception(exc)
+                # Mark retrieved so un-awaited followers don't log warnings
+                fut.exception()
+            raise
+        else:
+            self._store_loaded(key, result, ttl)
+            if not fut.done():
+                fut.set_result(result)
+            return result
+        finally:
+            self._ainflight.pop(fkey, None)
+
+    async def _arefresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: Optional[float]) -> None:
+        try:
+            self.stats.loads += 1
+            self._store_loaded(key, await loader(), ttl)
+        except Exception:
+            self.stats.load_errors += 1
+            self._clear_refreshing(key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"name": self.name, "size": len(self._data), "maxsize": self.maxsize, "policy": self.policy}
+        out.update(asdict(self.stats))
+        out["hit_ratio"] = round(self.stats.hit_ratio(), 4)
+        return out
+
+
+class _Flight:
+    """One in-progress synchronous load that followers can wait on."""
+
+    __slots__ = ("_event", "_result", "_exc")
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result: Any = None
+        self._exc: Optional[BaseException] = None
+
+    def done(self, result: Any) -> None:
+        self._result = result
+        self._event.set()
+
+    def fail(self, exc: BaseException) -> None:
+        self._exc = exc
+        self._event.set()
+
+    def wait(self) -> Any:
+        self._event.wait()
+        if self._exc is not None:
+            raise self._exc
+        return self._result
+
+
+class TwoTierCache:
+    """Local ``BoundedTTLCache`` (L1) backed by Redis (L2).
+
+    Values must be JSON-serialisable. Redis failures degrade to L1 only.
+    ``local_ttl`` is usually shorter than ``ttl`` so that writes from other
+    processes become visible quickly.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        redis_url: Optional[str],
+        *,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        local_ttl: Optional[float] = None,
+        negative_ttl: float = 0.0,
+        prefix: Optional[str] = None,
+        policy: str = "lru",
+    ):
+        self.name = name
+        self.redis_url = redis_url
+        self.ttl = float(ttl)
+        self.local_ttl = float(local_ttl) if local_ttl is not None else min(self.ttl, 5.0)
+        self.prefix = prefix or f"cache:{name}"
+        self.local = BoundedTTLCache(name, maxsize=maxsize, ttl=self.local_ttl, negative_ttl=negative_ttl, policy=policy)
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.local.stats
+
+    def _rkey(self, key: Hashable) -> str:
+        try:
+            raw = json.dumps(key, sort_keys=True, default=str)
+        except Exception:
+            raw = str(key)
+        return f"{self.prefix}:{raw}"
+
+    @staticmethod
+    def _json_default(o):
+        try:
+            return o.model_dump()
+        except Exception:
+            return str(o)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value, _ = self.local._lookup(key)
+        if value is NEGATIVE:
+            return default
+        if value is not _MISSING:
+            return value
+        r = get_redis(self.redis_url)
+        if r is None:
+            return default
+        try:
+            raw = r.get(self._rkey(key))
+        except Exception:
+            return default
+        if raw is None:
+            self.stats.l2_misses += 1
+            return default
+        try:
+            value = json.loads(raw)
+        except Exception:
+            return default
+        self.stats.l2_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl_val = self.ttl if ttl is None else float(ttl)
+        if ttl_val <= 0:
+            return
+        self.local.set(key, value, min(ttl_val, self.local_ttl))
+        r = get_redis(self.redis_url)
+        if r is None:
+            return
+        try:
+            r.set(self._rkey(key), json.dumps(value, default=self._json_default), ex=max(1, int(ttl_val)))
+        except Exception:
+            pass
+
+    def delete(self, key: Hashable) -> None:
+        self.local.delete(key)
+        r = get_redis(self.redis_url)
+        if r is None:
+            return
+        try:
+            r.delete(self._rkey(key))
+        except Exception:
+            pass
+
+    invalidate = delete
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        def _load():
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+
+        return self.local.get_or_load(key, _load, min(self.local_ttl, ttl) if ttl else None)
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    """Snapshot of every live named cache."""
+    with _REGISTRY_LOCK:
+        caches = list(_REGISTRY.values())
+    return [c.snapshot() for c in caches]
+
+
+def register_prometheus_collector(registry=None) -> bool:
+    """Expose cache counters as ``cache_*`` metrics labelled by cache name."""
+    try:
+        from prometheus_client import REGISTRY  # type: ignore
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily  # type: ignore
+    except Exception:
+        return False
+
+    class _CacheCollector:
+        def collect(self):
+            size = GaugeMetricFamily("cache_entries", "Entries held in cache", labels=["cache"])
+            counters = {
+                name: CounterMetricFamily(f"cache_{name}", f"Cache {name.replace('_', ' ')}", labels=["cache"])
+                for name in ("hits", "misses", "stale_hits", "negative_hits", "evictions", "expirations", "loads", "load_errors")
+            }
+            for snap in cache_stats():
+                size.add_metric([snap["name"]], float(snap["size"]))
+                for name, fam in counters.items():
+                    fam.add_metric([snap["name"]], float(snap.get(name, 0)))
+            return [size, *counters.values()]
+
+    try:
+        (registry or REGISTRY).register(_CacheCollector())
+    except ValueError:
+        return True
+    except Exception:
+        return False
+    return True
+
+
+__all__ = [
+    "BoundedTTLCache",
+    "TwoTierCache",
+    "CacheStats",
+    "NEGATIVE",
+    "cache_stats",
+    "register_prometheus_collector",
+]
@@ -0,0 +1,262 @@
+"""
+Grid cells, distances and polygon containment for "what is near / what am I in" lookups.
+
+Services used to load every zone or facility and compute haversine
+distances in Python. With this module they store a coarse grid cell per row
+(or per covered cell, for areas) in an indexed column, fetch only the rows in
+the cells around a point, and resolve containment against real polygons:
+
+- ``cell_id(lat, lon, cell_deg)``: one ``BIGINT`` per fixed lat/lon grid cell
+  (``cell_deg`` = 0.01 is ~1.1 km north-south), stable across processes,
+- ``cells_for_bbox`` / ``cells_around(lat, lon, radius_m)``: the cells to
+  store for an area, or to query around a point (a ``cell IN (...)`` probe),
+- ``Polygon``: an outer ring with optional holes; ``contains`` treats points
+  on an edge or vertex as inside and is robust to rays through vertices,
+  ``distance_m`` is 0 inside and the distance to the nearest edge outside,
+- ``haversine_m`` for exact point distances on the few candidates left.
+
+Coordinates are ``(lat, lon)`` everywhere except GeoJSON input
+(``Polygon.from_geojson``), which is ``[lon, lat]`` per the spec. Geometry
+is planar within a polygon (an equirectangular projection at its latitude),
+which is accurate to well under a metre at city-zone sizes; polygons
+crossing the antimeridian are not supported.
+
+Usage::
+
+    from superapp_shared.geo import Polygon, cell_id, cells_around, haversine_m
+
+    cells = cells_around(lat, lon, 2000, cell_deg=0.01)
+    rows = db.query(Zone).join(ZoneCell).filter(ZoneCell.cell.in_(cells)).all()
+    poly = Polygon.from_geojson(zone.polygon_geojson)
+    if poly.contains(lat, lon): ...
+"""
+from __future__ import annotations
+
+import json
+import math
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+EARTH_RADIUS_M = 6371008.8
+M_PER_DEG_LAT = 111_320.0
+# Coordinates closer than this (in metres, after projection) count as on the edge
+EDGE_EPS_M = 0.01
+MAX_QUERY_CELLS = 10_000
+
+Point = Tuple[float, float]
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    d_lat = p2 - p1
+    d_lon = math.radians(lon2 - lon1)
+    a = math.sin(d_lat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+# --- grid -------------------------------------------------------------------
+
+
+def _row_col(lat: float, lon: float, cell_deg: float) -> Tuple[int, int]:
+    if not (-90.0 <= lat <= 90.0) or not (-180.0 <= lon <= 180.0):
+        raise ValueError(f"coordinate out of range: {lat}, {lon}")
+    return int(math.floor((lat + 90.0) / cell_deg)), int(math.floor((lon + 180.0) / cell_deg))
+
+
+def _pack(row: int, col: int) -> int:
+    return (row << 32) | col
+
+
+def cell_id(lat: float, lon: float, cell_deg: float) -> int:
+    """Grid cell containing the point, as a non-negative 63-bit integer."""
+    return _pack(*_row_col(lat, lon, cell_deg))
+
+
+def cell_bounds(cell: int, cell_deg: float) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lon, max_lat, max_lon) of a cell from ``cell_id``."""
+    row, col = cell >> 32, cell & 0xFFFFFFFF
+    return row * cell_deg - 90.0, col * cell_deg - 180.0, (row + 1) * cell_deg - 90.0, (col + 1) * cell_deg - 180.0
+
+
+def cells_for_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float, cell_deg: float, limit: int = MAX_QUERY_CELLS) -> List[int]:
+    """Every cell overlapping the box; raises ``ValueError`` past ``limit`` cells."""
+    r0, c0 = _row_col(max(-90.0, min_lat), max(-180.0, min_lon), cell_deg)
+    r1, c1 = _row_col(min(90.0, max_lat), min(180.0, max_lon), cell_deg)
+    n = (r1 - r0 + 1) * (c1 - c0 + 1)
+    if n > limit:
+        raise ValueError(f"box covers {n} cells (limit {limit}); use a coarser cell_deg")
+    return [_pack(r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+
+
+def bbox_around(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    d_lat = radius_m / M_PER_DEG_LAT
+    d_lon = radius_m / (M_PER_DEG_LAT * max(0.01, math.cos(math.radians(lat))))
+    return lat - d_lat, lon - d_lon, lat + d_lat, lon + d_lon
+
+
+def cells_around(lat: float, lon: float, radius_m: float, cell_deg: float, limit: int = MAX_QUERY_CELLS) -> List[int]:
+    """Cells overlapping the square that bounds a ``radius_m`` circle around the point."""
+    return cells_for_bbox(*bbox_around(lat, lon, radius_m), cell_deg, limit=limit)
+
+
+# --- polygons ---------------------------------------------------------------
+
+
+def _clean_ring(ring: Sequence[Sequence[float]]) -> List[Point]:
+    pts: List[Point] = []
+    for p in ring:
+        lat, lon = float(p[0]), float(p[1])
+        if not (math.isfinite(lat) and math.isfinite(lon)) or not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+            raise ValueError(f"invalid vertex {p!r}")
+        if not pts or pts[-1] != (lat, lon):
+            pts.append((lat, lon))
+    if len(pts) > 1 and pts[0] == pts[-1]:
+        pts.pop()
+    if len(set(pts)) < 3:
+        raise ValueError("a ring needs at least 3 distinct vertices")
+    return pts
+
+
+class Polygon:
+    """Outer ring plus optional holes, vertices as ``(lat, lon)``; the closing vertex is optional."""
+
+    __slots__ = ("outer", "holes", "min_lat", "min_lon", "max_lat", "max_lon", "_kx", "_ky", "_lat0", "_lon0", "_rings_xy")
+
+    def __init__(self, outer: Sequence[Sequence[float]], holes: Iterable[Sequence[Sequence[float]]] = ()):
+        self.outer = _clean_ring(outer)
+        self.holes = [_clean_ring(h) for h in holes]
+        lats = [p[0] for p in self.outer]
+        lons = [p[1] for p in self.outer]
+        self.min_lat, self.max_lat = min(lats), max(lats)
+        self.min_lon, self.max_lon = min(lons), max(lons)
+        if self.max_lon - self.min_lon > 180:
+            raise ValueError("polygons crossing the antimeridian are not supported")
+        # Local planar frame in metres, so edge tolerance and distances are isotropic
+        self._lat0 = (self.min_lat + self.max_lat) / 2
+        self._lon0 = (self.min_lon + self.max_lon) / 2
+        self._ky = M_PER_DEG_LAT
+        self._kx = M_PER_DEG_LAT * math.cos(math.radians(self._lat0))
+        self._rings_xy = [[self._xy(lat, lon) for lat, lon in r] for r in (self.outer, *self.holes)]
+        if abs(self._signed_area(self._rings_xy[0])) <= EDGE_EPS_M:
+            raise ValueError("degenerate (zero-area) ring")
+
+    @classmethod
+    def from_geojson(cls, obj: Union[str, dict, list, None]) -> Optional["Polygon"]:
+        """``{"type": "Polygon", "coordinates": [[[lon, lat], ...], hole, ...]}``, the bare coordinates, or JSON text."""
+        if obj is None or obj == "":
+            return None
+        if isinstance(obj, str):
+            obj = json.loads(obj)
+        if isinstance(obj, dict):
+            if obj.get("type") == "Feature":
+                obj = obj.get("geometry") or {}
+            if obj.get("type") != "Polygon":
+                raise ValueError("only GeoJSON Polygon geometries are supported")
+            obj = obj.get("coordinates")
+        if not isinstance(obj, list) or not obj:
+            raise ValueError("polygon coordinates must be a non-empty list of rings")
+        rings = [[(p[1], p[0]) for p in ring] for ring in obj]
+        return cls(rings[0], rings[1:])
+
+    def to_geojson(self) -> dict:
+        def ring(r: List[Point]) -> list:
+            return [[lon, lat] for lat, lon in r] + [[r[0][1], r[0][0]]]
+
+        return {"type": "Polygon", "coordinates": [ring(self.outer), *(ring(h) for h in self.holes)]}
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        return self.min_lat, self.min_lon, self.max_lat, self.max_lon
+
+    def cells(self, cell_deg: float, limit: int = MAX_QUERY_CELLS) -> List[int]:
+        """Cells overlapping the bounding box (a superset of the cells the polygon touches)."""
+        return cells_for_bbox(*self.bbox, cell_deg, limit=limit)
+
+    def _xy(self, lat: float, lon: float) -> Point:
+        return (lon - self._lon0) * self._kx, (lat - self._lat0) * self._ky
+
+    @staticmethod
+    def _signed_area(ring: List[Point]) -> float:
+        s = 0.0
+        for i in range(len(ring)):
+            x1, y1 = ring[i - 1]
+            x2, y2 = ring[i]
+            s += x1 * y2 - x2 * y1
+        return s / 2
+
+    @property
+    def area_m2(self) -> float:
+        outer, *holes = self._rings_xy
+        return max(0.0, abs(self._signed_area(outer)) - sum(abs(self._signed_area(h)) for h in holes))
+
+    @staticmethod
+    def _seg_dist(px: float, py: float, ax: float, ay: float, bx: float, by: float) -> float:
+        dx, dy = bx - ax, by - ay
+        ll = dx * dx + dy * dy
+        t = 0.0 if ll == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / ll))
+        return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+    @classmethod
+    def _ring_locate(cls, ring: List[Point], x: float, y: float) -> int:
+        """1 inside, 0 on the boundary, -1 outside (crossing number with half-open edges)."""
+        inside = False
+        n = len(ring)
+        for i in range(n):
+            ax, ay = ring[i - 1]
+            bx, by = ring[i]
+            if cls._seg_dist(x, y, ax, ay, bx, by) <= EDGE_EPS_M:
+                return 0
+            # Half-open rule: an edge counts when it straddles y with one end strictly above,
+            # so a ray through a vertex is counted once and horizontal edges never
+            if (ay > y) != (by > y):
+                xi = ax + (y - ay) * (bx - ax) / (by - ay)
+                if xi > x:
+                    inside = not inside
+        return 1 if inside else -1
+
+    def contains(self, lat: float, lon: float) -> bool:
+        """True inside or on the boundary (outer edges and hole edges alike)."""
+        if not (self.min_lat - 1e-9 <= lat <= self.max_lat + 1e-9 and self.min_lon - 1e-9 <= lon <= self.max_lon + 1e-9):
+            return False
+        x, y = self._xy(lat, lon)
+        outer, *holes = self._rings_xy
+        where = self._ring_locate(outer, x, y)
+        if where < 0:
+            return False
+        if where == 0:
+            return True
+        for h in holes:
+            w = self._ring_locate(h, x, y)
+            if w == 0:
+                return True
+            if w > 0:
+                return False
+        return True
+
+    def distance_m(self, lat: float, lon: float) -> float:
+        """0 when contained, otherwise metres to the nearest edge (outer ring or hole)."""
+        if self.contains(lat, lon):
+            return 0.0
+        x, y = self._xy(lat, lon)
+        best = math.inf
+        for ring in self._rings_xy:
+            for i in range(len(ring)):
+                ax, ay = ring[i - 1]
+                bx, by = ring[i]
+                best = min(best, self._seg_dist(x, y, ax, ay, bx, by))
+        return best
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"Polygon({len(self.outer)} vertices, {len(self.holes)} holes)"
+
+
+__all__ = [
+    "EARTH_RADIUS_M",
+    "Polygon",
+    "bbox_around",
+    "cell_bounds",
+    "cell_id",
+    "cells_around",
+    "cells_for_bbox",
+    "haversine_m",
+]
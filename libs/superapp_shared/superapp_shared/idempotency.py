@@ -0,0 +1,740 @@
+"""
+Idempotency layer with full response replay.
+
+Endpoints used to keep their own idempotency rows (payments'
+``idempotency_keys`` stores a ``result_ref`` and the handler re-reads the
+result on retry; internal endpoints look the transfer up by key). This module
+handles ``Idempotency-Key`` / ``X-Idempotency-Key`` in front of the handler:
+
+- the first request with a key claims it and runs; its status, headers and
+  body are stored and every retry gets the stored response back
+  (``Idempotent-Replayed: true``) without touching the handler,
+- a key reused with a different request (query + canonical body) gets 409,
+- concurrent duplicates wait for the first one instead of racing it
+  (in-process via an event, across replicas by polling the store) and then
+  replay its response; a claim whose owner died expires after ``lock_secs``,
+- only successful responses (< 400 by default) are stored: a failed request
+  releases its claim so the client can retry it,
+- entries expire after ``ttl_secs`` and ``store.gc()`` deletes them.
+
+Keys are scoped by service, caller credential (digest of the Authorization /
+internal secret header, or what ``credential`` returns), method and path, so
+two callers never see each other's responses. Requests without a credential
+pass through untouched.
+
+Stores: ``SqlIdempotencyStore`` (``idempotency_responses`` table, durable),
+``RedisIdempotencyStore`` (fast, TTL-expired), ``TieredIdempotencyStore``
+(Redis fast path for replays, DB for claims and durability) and
+``MemoryIdempotencyStore``; ``idempotency_store_from_env`` picks one
+(``IDEMPOTENCY_BACKEND``).
+
+Usage::
+
+    from superapp_shared.idempotency import IdempotencyMiddleware, idempotency_store_from_env
+
+    store = idempotency_store_from_env(engine, settings.REDIS_URL)
+    app.add_middleware(IdempotencyMiddleware, store=store, service="payments", paths=["/internal", "/wallet"])
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .redis_pool import get_redis
+
+
+log = logging.getLogger(__name__)
+
+IN_FLIGHT = "in_flight"
+COMPLETED = "completed"
+KEY_HEADERS = ("idempotency-key", "x-idempotency-key")
+REPLAY_HEADER = "idempotent-replayed"
+# Per-request headers that must not be replayed
+_SKIP_HEADERS = {"date", "server", "set-cookie", "x-request-id", "traceparent", REPLAY_HEADER}
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+    def to_dict(self) -> dict:
+        return {"status": self.status, "headers": [list(h) for h in self.headers], "body": base64.b64encode(self.body).decode()}
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> "StoredResponse":
+        return cls(int(d["status"]), [(str(k), str(v)) for k, v in d.get("headers") or []], base64.b64decode(d.get("body") or ""))
+
+
+@dataclass
+class Entry:
+    state: str
+    fingerprint: str
+    owner: str
+    response: Optional[StoredResponse] = None
+    lock_expired: bool = False
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "state": self.state,
+            "fp": self.fingerprint,
+            "owner": self.owner,
+            "response": self.response.to_dict() if self.response else None,
+        })
+
+    @classmethod
+    def from_json(cls, raw) -> "Entry":
+        d = json.loads(raw)
+        resp = d.get("response")
+        return cls(d["state"], d["fp"], d["owner"], StoredResponse.from_dict(resp) if resp else None)
+
+
+class IdempotencyStore:
+    """Claims and stored responses by scoped key.
+
+    ``claim`` returns ``None`` when the caller now owns the key, else the existing entry
+    (completed, or in flight for someone else).
+    """
+
+    def claim(self, key: str, fingerprint: str, owner: str, lock_secs: float, ttl_secs: float) -> Optional[Entry]:
+        raise NotImplementedError
+
+    def complete(self, key: str, owner: str, response: StoredResponse, ttl_secs: float) -> bool:
+        raise NotImplementedError
+
+    def release(self, key: str, owner: str) -> None:
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[Entry]:
+        raise NotImplementedError
+
+    def gc(self, limit: int = 10_000) -> int:
+        """Delete expired entries; returns the number removed."""
+        return 0
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._data: Dict[str, Tuple[Entry, float, float]] = {}  # key -> (entry, locked_until, expires_at)
+        self._lock = threading.Lock()
+
+    def claim(self, key, fingerprint, owner, lock_secs, ttl_secs):
+        now = self.clock()
+        with self._lock:
+            cur = self._data.get(key)
+            if cur is not None:
+                entry, locked_until, expires_at = cur
+                if expires_at > now and (entry.state == COMPLETED or locked_until > now):
+                    return entry
+            self._data[key] = (Entry(IN_FLIGHT, fingerprint, owner), now + lock_secs, now + ttl_secs)
+            return None
+
+    def complete(self, key, owner, response, ttl_secs):
+        with self._lock:
+            cur = self._data.get(key)
+            if cur is None or cur[0].owner != owner:
+                return False
+            self._data[key] = (Entry(COMPLETED, cur[0].fingerprint, owner, response), 0.0, self.clock() + ttl_secs)
+            return True
+
+    def release(self, key, owner):
+        with self._lock:
+            cur = self._data.get(key)
+            if cur is not None and cur[0].owner == owner and cur[0].state == IN_FLIGHT:
+                del self._data[key]
+
+    def get(self, key):
+        now = self.clock()
+        with self._lock:
+            cur = self._data.get(key)
+        if cur is None or cur[2] <= now:
+            return None
+        entry, locked_until, _ = cur
+        if entry.state == IN_FLIGHT and locked_until <= now:
+            return Entry(entry.state, entry.fingerprint, entry.owner, lock_expired=True)
+        return entry
+
+    def gc(self, limit=10_000):
+        now = self.clock()
+        with self._lock:
+            dead = [k for k, (_, _, exp) in self._data.items() if exp <= now][:limit]
+            for k in dead:
+                del self._data[k]
+        return len(dead)
+
+
+_CLAIM_LUA = """
+local v = redis.call('GET', KEYS[1])
+if v then return v end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return false
+"""
+
+_COMPLETE_LUA = """
+local v = redis.call('GET', KEYS[1])
+if not v or cjson.decode(v)['owner'] ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+return 1
+"""
+
+_RELEASE_LUA = """
+local v = redis.call('GET', KEYS[1])
+if v then
+  local e = cjson.decode(v)
+  if e['owner'] == ARGV[1] and e['state'] == 'in_flight' then redis.call('DEL', KEYS[1]) end
+end
+return 1
+"""
+
+
+class RedisIdempotencyStore(IdempotencyStore):
+    """One JSON value per key; an in-flight claim's TTL is the lock, a completed entry's TTL the retention."""
+
+    def __init__(self, url: str, prefix: str = "idem", client=None):
+        self._r = client if client is not None else get_redis(url, decode_responses=True)
+        if self._r is None:
+            raise RuntimeError("redis unavailable for idempotency store")
+        self.prefix = prefix
+        self._claim = self._r.register_script(_CLAIM_LUA)
+        self._complete = self._r.register_script(_COMPLETE_LUA)
+        self._release = self._r.register_script(_RELEASE_LUA)
+
+    def _k(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def claim(self, key, fingerprint, owner, lock_secs, ttl_secs):
+        raw = self._claim(keys=[self._k(key)], args=[Entry(IN_FLIGHT, fingerprint, owner).to_json(), max(1, int(lock_secs * 1000))])
+        return Entry.from_json(raw) if raw else None
+
+    def complete(self, key, owner, response, ttl_secs):
+        entry = Entry(COMPLETED, "", owner, response)
+        cur = self._r.get(self._k(key))
+        if cur:
+            entry.fingerprint = json.loads(cur)["fp"]
+        return bool(self._complete(keys=[self._k(key)], args=[owner, entry.to_json(), max(1, int(ttl_secs * 1000))]))
+
+    def put(self, key: str, entry: Entry, ttl_secs: float) -> None:
+        """Cache a completed entry (used by the tiered store)."""
+        self._r.set(self._k(key), entry.to_json(), px=max(1, int(ttl_secs * 1000)))
+
+    def release(self, key, owner):
+        self._release(keys=[self._k(key)], args=[owner])
+
+    def get(self, key):
+        raw = self._r.get(self._k(key))
+        return Entry.from_json(raw) if raw else None
+
+
+class SqlIdempotencyStore(IdempotencyStore):
+    """Postgres-backed store (``idempotency_responses``); expiry uses the DB clock.
+
+    The table is created on first use (``create=False`` when migrations own it).
+    """
+
+    def __init__(self, engine, create: bool = True):
+        self.engine = engine
+        self._tables = _sql_tables()
+        self._ready = not create
+        self._schema_lock = threading.Lock()
+
+    def ensure_schema(self) -> None:
+        with self._schema_lock:
+            self._tables["metadata"].create_all(self.engine, checkfirst=True)
+            self._ready = True
+
+    def _exec(self, sql: str, **params):
+        from sqlalchemy import text  # type: ignore
+
+        if not self._ready:
+            self.ensure_schema()
+        with self.engine.begin() as conn:
+            res = conn.execute(text(sql), params)
+            return res.fetchall() if res.returns_rows else res.rowcount
+
+    def claim(self, key, fingerprint, owner, lock_secs, ttl_secs):
+        for _ in range(3):
+            rows = self._exec(
+                """
+                INSERT INTO idempotency_responses (scope_key, fingerprint, state, owner, locked_until, expires_at, created_at)
+                VALUES (:k, :fp, 'in_flight', :o, clock_timestamp() + make_interval(secs => :lock),
+                        clock_timestamp() + make_interval(secs => :ttl), clock_timestamp())
+                ON CONFLICT (scope_key) DO UPDATE SET
+                    fingerprint = EXCLUDED.fingerprint, state = 'in_flight', owner = EXCLUDED.owner,
+                    status_code = NULL, headers = NULL, body = NULL,
+                    locked_until = EXCLUDED.locked_until, expires_at = EXCLUDED.expires_at, created_at = EXCLUDED.created_at
+                WHERE idempotency_responses.expires_at <= clock_timestamp()
+                   OR (idempotency_responses.state = 'in_flight' AND idempotency_responses.locked_until <= clock_timestamp())
+                RETURNING owner
+                """,
+                k=key, fp=fingerprint, o=owner, lock=float(lock_secs), ttl=float(ttl_secs),
+            )
+            if rows:
+                return None
+            entry = self.get(key)
+            if entry is not None and not entry.lock_expired:
+                return entry
+        return self.get(key)
+
+    def complete(self, key, owner, response, ttl_secs):
+        rows = self._exec(
+            """
+            UPDATE idempotency_responses
+               SET state = 'completed', status_code = :s, headers = :h, body = :b,
+                   expires_at = clock_timestamp() + make_interval(secs => :ttl)
+             WHERE scope_key = :k AND owner = :o
+            RETURNING scope_key
+            """,
+            k=key, o=owner, s=response.status, h=json.dumps([list(h) for h in response.headers]), b=response.body, ttl=float(ttl_secs),
+        )
+        return bool(rows)
+
+    def release(self, key, owner):
+        self._exec("DELETE FROM idempotency_responses WHERE scope_key = :k AND owner = :o AND state = 'in_flight'", k=key, o=owner)
+
+    def get(self, key):
+        rows = self._exec(
+            """
+            SELECT state, fingerprint, owner, status_code, headers, body, locked_until <= clock_timestamp()
+              FROM idempotency_responses WHERE scope_key = :k AND expires_at > clock_timestamp()
+            """,
+            k=key,
+        )
+        if not rows:
+            return None
+        state, fp, owner, status, headers, body, lock_expired = rows[0]
+        resp = None
+        if state == COMPLETED:
+            hdrs = json.loads(headers) if isinstance(headers, str) else (headers or [])
+            resp = StoredResponse(int(status), [(str(k), str(v)) for k, v in hdrs], bytes(body or b""))
+        return Entry(state, fp, owner, resp, lock_expired=bool(lock_expired) and state == IN_FLIGHT)
+
+    def gc(self, limit=10_000):
+        return int(self._exec(
+            """
+            DELETE FROM idempotency_responses WHERE scope_key IN (
+                SELECT scope_key FROM idempotency_responses WHERE expires_at <= clock_timestamp() LIMIT :n
+            )
+            """,
+            n=int(limit),
+        ) or 0)
+
+
+class TieredIdempotencyStore(IdempotencyStore):
+    """Claims and durability in the DB; completed responses cached in Redis so replays skip the DB."""
+
+    def __init__(self, db: SqlIdempotencyStore, cache: Optional[RedisIdempotencyStore]):
+        self.db = db
+        self.cache = cache
+
+    def _cached(self, key: str) -> Optional[Entry]:
+        if self.cache is None:
+            return None
+        try:
+            e = self.cache.get(key)
+        except Exception:
+            log.warning("idempotency cache read failed", exc_info=True)
+            return None
+        return e if e is not None and e.state == COMPLETED else None
+
+    def _fill(self, key: str, entry: Entry, ttl_secs: float) -> None:
+        if self.cache is not None:
+            try:
+                self.cache.put(key, entry, ttl_secs)
+            except Exception:
+                log.warning("idempotency cache write failed", exc_info=True)
+
+    def claim(self, key, fingerprint, owner, lock_secs, ttl_secs):
+        hit = self._cached(key)
+        if hit is not None:
+            return hit
+        entry = self.db.claim(key, fingerprint, owner, lock_secs, ttl_secs)
+        if entry is not None and entry.state == COMPLETED:
+            self._fill(key, entry, ttl_secs)
+        return entry
+
+    def complete(self, key, owner, response, ttl_secs):
+        ok = self.db.complete(key, owner, response, ttl_secs)
+        if ok:
+            entry = self.db.get(key)
+            if entry is not None:
+                self._fill(key, entry, ttl_secs)
+        return ok
+
+    def release(self, key, owner):
+        self.db.release(key, owner)
+
+    def get(self, key):
+        return self._cached(key) or self.db.get(key)
+
+    def gc(self, limit=10_000):
+        return self.db.gc(limit)
+
+
+_SQL_TABLES: Optional[dict] = None
+
+
+def _sql_tables() -> dict:
+    global _SQL_TABLES
+    if _SQL_TABLES is None:
+        from sqlalchemy import Column, DateTime, Index, Integer, LargeBinary, MetaData, String, Table, Text  # type: ignore
+
+        md = MetaData()
+        _SQL_TABLES = {
+            "metadata": md,
+            "responses": Table(
+                "idempotency_responses", md,
+                Column("scope_key", String(512), primary_key=True),
+                Column("fingerprint", String(64), nullable=False),
+                Column("state", String(16), nullable=False),
+                Column("owner", String(64), nullable=False),
+                Column("status_code", Integer, nullable=True),
+                Column("headers", Text, nullable=True),
+                Column("body", LargeBinary, nullable=True),
+                Column("locked_until", DateTime(timezone=True), nullable=False),
+                Column("expires_at", DateTime(timezone=True), nullable=False),
+                Column("created_at", DateTime(timezone=True), nullable=False),
+                Index("ix_idempotency_responses_expires", "expires_at"),
+            ),
+        }
+    return _SQL_TABLES
+
+
+def idempotency_store_from_env(engine=None, redis_url: Optional[str] = None, prefix: str = "idem") -> IdempotencyStore:
+    """``IDEMPOTENCY_BACKEND`` = tiered|db|redis|memory (default: tiered with an engine and Redis, else db, redis, memory)."""
+    backend = (os.getenv("IDEMPOTENCY_BACKEND", "") or "").lower()
+    if not backend:
+        backend = "tiered" if engine is not None and redis_url else "db" if engine is not None else "redis" if redis_url else "memory"
+
+    def _redis() -> Optional[RedisIdempotencyStore]:
+        try:
+            return RedisIdempotencyStore(redis_url, prefix=prefix) if redis_url else None
+        except Exception:
+            log.warning("idempotency: redis unavailable", exc_info=True)
+            return None
+
+    if backend in ("tiered", "db") and engine is not None:
+        db = SqlIdempotencyStore(engine)
+        return TieredIdempotencyStore(db, _redis()) if backend == "tiered" else db
+    if backend == "redis":
+        store = _redis()
+        if store is not None:
+            return store
+    return MemoryIdempotencyStore()
+
+
+# --- request handling -------------------------------------------------------------
+
+
+def default_credential(headers: Mapping[str, str], body: bytes) -> Optional[str]:
+    """Who is calling: the bearer token, internal shared secret or API key (hashed into the scope)."""
+    for name in ("authorization", "x-internal-secret", "x-api-key"):
+        v = headers.get(name)
+        if v:
+            return f"{name}:{v}"
+    return None
+
+
+def request_fingerprint(query: bytes, body: bytes) -> str:
+    try:
+        canon = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode() if body.strip() else b""
+    except (ValueError, UnicodeDecodeError):
+        canon = body
+    return hashlib.sha256(query + b"\n" + canon).hexdigest()
+
+
+_stats: Dict[str, Counter] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(service: str, what: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats.setdefault(service, Counter())[what] += n
+
+
+def idempotency_stats() -> Dict[str, Dict[str, int]]:
+    """Per service: executed, replayed, coalesced, conflicts, in_progress, stored, released, errors, gc_deleted."""
+    with _stats_lock:
+        return {s: dict(c) for s, c in _stats.items()}
+
+
+def run_gc(store: IdempotencyStore, service: str = "", limit: int = 10_000) -> int:
+    n = store.gc(limit)
+    if n:
+        _count(service, "gc_deleted", n)
+    return n
+
+
+def _json_response(status: int, detail: str, extra: Sequence[Tuple[bytes, bytes]] = ()):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *extra]
+    return status, headers, body
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware applying the idempotency layer to mutating requests that carry a key.
+
+    ``body_field`` additionally reads the key from a top-level JSON body field (e.g.
+    ``idempotency_key``) when no header is sent. ``paths`` / ``exclude_paths`` are prefixes.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: IdempotencyStore,
+        *,
+        service: str = "",
+        paths: Optional[Sequence[str]] = None,
+        exclude_paths: Sequence[str] = (),
+        methods: Sequence[str] = ("POST", "PUT", "PATCH", "DELETE"),
+        body_field: Optional[str] = None,
+        credential: Callable[[Mapping[str, str], bytes], Optional[str]] = default_credential,
+        ttl_secs: Optional[float] = None,
+        lock_secs: Optional[float] = None,
+        wait_secs: Optional[float] = None,
+        poll_secs: float = 0.05,
+        store_status: Callable[[int], bool] = lambda s: s < 400,
+        max_body_bytes: int = 1_000_000,
+    ):
+        self.app = app
+        self.store = store
+        self.service = service
+        self.paths = tuple(paths) if paths else None
+        self.exclude_paths = tuple(exclude_paths)
+        self.methods = {m.upper() for m in methods}
+        self.body_field = body_field
+        self.credential = credential
+        self.ttl_secs = float(ttl_secs if ttl_secs is not None else os.getenv("IDEMPOTENCY_TTL_SECS", "86400"))
+        self.lock_secs = float(lock_secs if lock_secs is not None else os.getenv("IDEMPOTENCY_LOCK_SECS", "30"))
+        self.wait_secs = float(wait_secs if wait_secs is not None else os.getenv("IDEMPOTENCY_WAIT_SECS", "10"))
+        self.poll_secs = poll_secs
+        self.store_status = store_status
+        self.max_body_bytes = max_body_bytes
+        self._local: Dict[str, threading.Event] = {}
+        self._local_lock = threading.Lock()
+
+    def _applies(self, scope) -> bool:
+        if scope.get("type") != "http" or scope.get("method", "").upper() not in self.methods:
+            return False
+        path = scope.get("path", "")
+        if any(path.startswith(p) for p in self.exclude_paths):
+            return False
+        return self.paths is None or any(path.startswith(p) for p in self.paths)
+
+    def _key_from(self, headers: Mapping[str, str], body: bytes) -> Optional[str]:
+        for name in KEY_HEADERS:
+            v = (headers.get(name) or "").strip()
+            if v:
+                return v
+        if self.body_field and body:
+            try:
+                v = json.loads(body).get(self.body_field)
+            except (ValueError, AttributeError, UnicodeDecodeError):
+                return None
+            if isinstance(v, str) and v.strip():
+                return v.strip()
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+        body, more = b"", True
+        while more:
+            msg = await receive()
+            if msg["type"] != "http.request":
+                break
+            body += msg.get("body", b"")
+            more = msg.get("more_body", False)
+        sent = False
+
+        async def replay_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers") or []}
+        key = self._key_from(headers, body)
+        cred = self.credential(headers, body) if key else None
+        if not key or len(key) > 255 or cred is None:
+            await self.app(scope, replay_receive, send)
+            return
+
+        cred_digest = hashlib.sha256(cred.encode()).hexdigest()[:24]
+        scoped = f"{self.service}:{cred_digest}:{scope['method'].upper()}:{scope.get('path', '')}:{key}"
+        fp = request_fingerprint(scope.get("query_string", b""), body)
+        await self._handle(scope, replay_receive, send, scoped, fp)
+
+    async def _handle(self, scope, receive, send, scoped: str, fp: str):
+        from anyio import to_thread  # type: ignore
+
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_secs
+        waited = False
+        while True:
+            try:
+                entry = await to_thread.run_sync(self.store.claim, scoped, fp, owner, self.lock_secs, self.ttl_secs)
+            except Exception:
+                # Fail open: the handlers' own idempotency still applies
+                _count(self.service, "errors")
+                log.warning("idempotency store unavailable; passing request through", exc_info=True)
+                await self.app(scope, receive, send)
+                return
+            if entry is None:
+                await self._lead(scope, receive, send, scoped, owner)
+                return
+            if entry.fingerprint and entry.fingerprint != fp:
+                _count(self.service, "conflicts")
+                await self._send(send, *_json_response(409, "Idempotency-Key reused with a different request"))
+                return
+            if entry.state == COMPLETED and entry.response is not None:
+                _count(self.service, "coalesced" if waited else "replayed")
+                r = entry.response
+                hdrs = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in r.headers] + [(REPLAY_HEADER.encode(), b"true")]
+                await self._send(send, r.status, hdrs, r.body)
+                return
+            # In flight elsewhere: wait for it to finish, then replay (or take over if it failed)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _count(self.service, "in_progress")
+                await self._send(send, *_json_response(409, "A request with this Idempotency-Key is in progress", [(b"retry-after", b"1")]))
+                return
+            waited = True
+            with self._local_lock:
+                ev = self._local.get(scoped)
+            if ev is not None:
+                await to_thread.run_sync(ev.wait, remaining)
+            else:
+                await to_thread.run_sync(self._poll, scoped, remaining)
+
+    def _poll(self, scoped: str, timeout: float) -> None:
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            e = self.store.get(scoped)
+            if e is None or e.state == COMPLETED or e.lock_expired:
+                return
+            time.sleep(self.poll_secs)
+
+    async def _lead(self, scope, receive, send, scoped: str, owner: str):
+        from anyio import to_thread  # type: ignore
+
+        ev = threading.Event()
+        with self._local_lock:
+            self._local[scoped] = ev
+        start: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+        stored = False
+
+        async def capture(message):
+            nonlocal stored
+            if message["type"] == "http.response.start":
+                start.update(message)
+                await send(message)
+                return
+            if message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    stored = await to_thread.run_sync(self._store, scoped, owner, start, b"".join(chunks))
+                await send(message)
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+            _count(self.service, "executed")
+        finally:
+            if not stored:
+                try:
+                    await to_thread.run_sync(self.store.release, scoped, owner)
+                    _count(self.service, "released")
+                except Exception:
+                    log.warning("idempotency release failed", exc_info=True)
+            with self._local_lock:
+                if self._local.get(scoped) is ev:
+                    del self._local[scoped]
+            ev.set()
+
+    def _store(self, scoped: str, owner: str, start: Mapping[str, Any], body: bytes) -> bool:
+        status = int(start.get("status") or 500)
+        if not self.store_status(status) or len(body) > self.max_body_bytes:
+            return False
+        headers = [
+            (k.decode("latin-1"), v.decode("latin-1"))
+            for k, v in start.get("headers") or []
+            if k.decode("latin-1").lower() not in _SKIP_HEADERS
+        ]
+        try:
+            ok = self.store.complete(scoped, owner, StoredResponse(status, headers, body), self.ttl_secs)
+        except Exception:
+            _count(self.service, "errors")
+            log.warning("idempotency response store failed", exc_info=True)
+            return False
+        if ok:
+            _count(self.service, "stored")
+        return ok
+
+    @staticmethod
+    async def _send(send, status: int, headers, body: bytes):
+        await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+
+def register_prometheus_collector(registry=None) -> bool:
+    """Expose ``idempotency_requests_total{service,outcome}`` and ``idempotency_gc_deleted_total``."""
+    try:
+        from prometheus_client import REGISTRY  # type: ignore
+        from prometheus_client.core import CounterMetricFamily  # type: ignore
+    except Exception:
+        return False
+
+    class _IdempotencyCollector:
+        def collect(self):
+            reqs = CounterMetricFamily("idempotency_requests", "Keyed requests by outcome", labels=["service", "outcome"])
+            gc = CounterMetricFamily("idempotency_gc_deleted", "Expired idempotency entries deleted", labels=["service"])
+            for service, counts in idempotency_stats().items():
+                for outcome, n in counts.items():
+                    if outcome == "gc_deleted":
+                        gc.add_metric([service], float(n))
+                    else:
+                        reqs.add_metric([service, outcome], float(n))
+            return [reqs, gc]
+
+    try:
+        (registry or REGISTRY).register(_IdempotencyCollector())
+    except ValueError:
+        return True
+    except Exception:
+        return False
+    return True
+
+
+__all__ = [
+    "COMPLETED",
+    "Entry",
+    "IN_FLIGHT",
+    "IdempotencyMiddleware",
+    "IdempotencyStore",
+    "MemoryIdempotencyStore",
+    "RedisIdempotencyStore",
+    "SqlIdempotencyStore",
+    "StoredResponse",
+    "TieredIdempotencyStore",
+    "default_credential",
+    "idempotency_stats",
+    "idempotency_store_from_env",
+    "register_prometheus_collector",
+    "request_fingerprint",
+    "run_gc",
+]
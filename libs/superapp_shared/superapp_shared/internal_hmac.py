@@ -4,10 +4,7 @@ import json
 import os
 from typing import Optional, Dict
 
-try:
-    import redis  # type: ignore
-except Exception:  # pragma: no cover
-    redis = None  # type: ignore
+from .redis_pool import get_redis
 
 
 def canonical_json(obj: dict) -> str:
@@ -32,12 +29,8 @@ def sign_internal_request_headers(payload: dict, secret: str, ts: Optional[str]
 
 
 def _redis_client(url: Optional[str]):
-    if not url or redis is None:
-        return None
-    try:
-        return redis.from_url(url)
-    except Exception:
-        return None
+    # Shared pooled client; avoids a new connection per verification
+    return get_redis(url)
 
 
 def verify_internal_hmac_with_replay(
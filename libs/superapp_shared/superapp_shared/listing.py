@@ -0,0 +1,93 @@
+"""
+Keyset cursors, prefix text search and ``Link`` headers for paged list endpoints.
+
+List endpoints page on (sort key, id) instead of ``OFFSET`` and match free
+text against a ``simple`` tsvector column. The pieces every service needs for
+that are the same:
+
+- ``encode_cursor(sort, value, row_id)`` / ``decode_cursor(cursor, sort, parse)``:
+  an opaque, URL-safe token for the last row of a page. ``value`` is the sort
+  key (datetimes are sent as ISO strings, tuples as lists); ``parse`` turns
+  the decoded JSON value back into what the query compares against and may
+  raise ``ValueError``/``TypeError`` for a malformed one. A token issued for
+  another sort, or not issued here at all, raises ``InvalidCursor``
+  (a ``ValueError``, so routers answer it with their usual 400).
+- ``prefix_tsquery(q)``: a ``tsquery`` requiring a prefix match of every word
+  in ``q`` (``"bab tou"`` finds "Bab Touma"), or None when ``q`` has no words.
+- ``set_next_link(request, response, cursor, limit)``: the RFC 8288 ``Link``
+  header pointing at the next page, when there is one.
+
+Usage::
+
+    from superapp_shared.listing import decode_cursor, encode_cursor, prefix_tsquery, set_next_link
+
+    tsq = prefix_tsquery(q)
+    if tsq is not None:
+        stmt = stmt.where(Model.search_vector.op("@@")(tsq))
+    if cursor:
+        created, rid = decode_cursor(cursor, "newest", datetime.fromisoformat)
+        stmt = stmt.where(tuple_(Model.created_at, Model.id) < tuple_(created, rid))
+    ...
+    set_next_link(request, response, encode_cursor("newest", last.created_at, last.id), limit)
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+import re
+import uuid
+from datetime import date, datetime
+from typing import Any, Callable, Optional, Tuple
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+class InvalidCursor(ValueError):
+    """The cursor is not one issued by ``encode_cursor`` for this sort."""
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, tuple):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+def encode_cursor(sort: str, value: Any, row_id: Any) -> str:
+    """Token for the row with sort key ``value`` and id ``row_id`` under ``sort``."""
+    raw = json.dumps([sort, _jsonable(value), str(row_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, parse: Callable[[Any], Any] = lambda v: v) -> Tuple[Any, uuid.UUID]:
+    """``(parse(sort value), row id)`` of the last row of the previous page."""
+    try:
+        c_sort, value, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if c_sort == sort:
+            value = parse(value)
+        row_id = uuid.UUID(row_id)
+    except (binascii.Error, TypeError, ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+    if c_sort != sort:
+        raise InvalidCursor("Cursor belongs to another sort")
+    return value, row_id
+
+
+def prefix_tsquery(q: Optional[str], config: str = "simple"):
+    """``tsquery`` requiring a prefix match of every word in ``q``; None when it has no words."""
+    words = _WORD.findall((q or "").lower())
+    if not words:
+        return None
+    from sqlalchemy import func  # type: ignore
+
+    return func.to_tsquery(config, " & ".join(f"{w}:*" for w in words))
+
+
+def set_next_link(request, response, cursor: Optional[str], limit: int) -> None:
+    """Point the ``Link`` header at the page after this one (the same query with ``cursor``, without ``offset``)."""
+    if not cursor:
+        return
+    next_url = request.url.remove_query_params("offset").include_query_params(cursor=cursor, limit=limit)
+    response.headers["Link"] = f'<{next_url}>; rel="next"'
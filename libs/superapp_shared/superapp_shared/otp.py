@@ -7,11 +7,6 @@ from typing import Optional, Dict
 import hashlib
 import hmac
 
-try:
-    import redis  # type: ignore
-except Exception:  # pragma: no cover
-    redis = None  # type: ignore
-
 try:
     from .env_loader import ensure_loaded as _ensure_env_loaded
 except Exception:  # pragma: no cover
@@ -19,6 +14,7 @@ except Exception:  # pragma: no cover
         return None
 
 from .phone_utils import normalize_phone_e164
+from .redis_pool import get_redis
 
 
 _DEFAULT_STATIC_DEV_CODES = {
@@ -102,12 +98,8 @@ def from_env(prefix: str = "") -> OTPConfig:
 
 
 def _redis_client(url: Optional[str]):
-    if not url or redis is None:
-        return None
-    try:
-        return redis.from_url(url)
-    except Exception:
-        return None
+    # Shared pooled client; avoids a new connection per OTP operation
+    return get_redis(url)
 
 
 def generate_otp_code() -> str:
@@ -0,0 +1,653 @@
+"""
+Payment handoff sagas: durable "ask Payments to charge for this booking" records.
+
+Marketplace services used to create the booking, then call Payments'
+``/internal/requests`` inline with a short timeout and swallow any failure, so
+a Payments blip left the booking without a ``payment_request_id`` and nothing
+ever asked again; the seat or slot stayed taken until someone noticed.
+``PaymentSaga`` splits the handoff into steps that survive crashes and outages:
+
+- ``begin(db, kind, ref_id, ...)`` adds a ``payment_sagas`` row through the
+  caller's session, so it commits or rolls back together with the booking
+  (one saga per ``(service, kind, ref_id)``);
+- ``dispatch(saga_id)`` (right after the commit, so a healthy Payments still
+  answers within the booking request) and ``process_due()`` (a scheduler job)
+  send it with an ``X-Idempotency-Key`` fixed per booking, so a retry after a
+  lost response gets the same payment request back instead of a second one.
+  Connection errors, timeouts, 5xx, 408, 409 and 429 are retried with
+  exponential backoff;
+- on success the ``@saga.on_requested(kind)`` handler links the payment
+  request to the business row, in the transaction that marks the saga
+  ``requested``;
+- when Payments refuses the request (any other 4xx) or ``max_attempts`` run
+  out, the ``@saga.on_failed(kind)`` handler releases the booking, slot or
+  seat, in the transaction that marks the saga ``compensated``. A handler that
+  raises leaves the saga ``compensating`` and it is retried until it succeeds.
+  Timeouts and 5xx don't say whether Payments created the request, so before
+  releasing after ``max_attempts`` the saga withdraws whatever Payments holds
+  under its idempotency key; until Payments answers that, the saga stays
+  ``compensating`` and the booking stays held. A request the user already
+  paid stands: the saga ends ``requested`` instead;
+- ``status(db, kind, ref_id)`` backs the clients' payment status endpoints, and
+  ``cancel(db, kind, ref_id)`` stops a saga that is not in flight (the booking
+  was canceled first); one that was sent before withdraws the request its
+  lost answers may have created. When it returns False the request may
+  already exist: ``void(db, kind, ref_id)`` withdraws a recorded one, and an
+  ``on_requested`` handler that finds the booking canceled returns False so
+  one still in flight is withdrawn as soon as it is recorded. Withdrawing
+  (``voiding``, ``POST /internal/requests/cancel`` by idempotency key) is
+  retried like a request until Payments answers.
+
+States: ``pending`` -> ``requested`` [-> ``voiding`` -> ``voided``], or
+``pending`` -> [``compensating``] -> ``compensated`` (or ``requested``), or
+``pending`` -> [``voiding``] -> ``canceled``.
+
+Handlers get a ``Session`` and the ``SagaRecord``; they must be idempotent and
+check the business row's current state, since the user may cancel meanwhile
+and a worker that dies mid-step is retried once its lease expires.
+
+Claims use ``FOR UPDATE SKIP LOCKED`` with a lease, so replicas share the
+backlog; times use the DB clock. The table is created on first use
+(``create=False`` when migrations own it).
+
+Usage::
+
+    from superapp_shared.payment_saga import PaymentSaga
+
+    saga = PaymentSaga(
+        "carrental", SessionLocal,
+        base_url=lambda: settings.PAYMENTS_BASE_URL,
+        secret=lambda: settings.PAYMENTS_INTERNAL_SECRET,
+    )
+
+    @saga.on_requested("booking")
+    def _linked(db, rec):
+        db.get(Booking, uuid.UUID(rec.ref_id)).payment_request_id = rec.payment_request_id
+
+    @saga.on_failed("booking")
+    def _release(db, rec):
+        ...
+
+    # in the booking endpoint
+    saga_id = saga.begin(db, "booking", b.id, from_phone=user.phone, to_phone=fee_phone, amount_cents=total)
+    db.commit()
+    saga.dispatch(saga_id)
+
+    # scheduler job
+    sched.add_job("carrental_payment_saga", lambda ctx: saga.process_due(), IntervalTrigger(15))
+"""
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+import httpx
+
+from .internal_hmac import sign_internal_request_headers
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+REQUESTED = "requested"
+COMPENSATING = "compensating"
+COMPENSATED = "compensated"
+CANCELED = "canceled"
+VOIDING = "voiding"
+VOIDED = "voided"
+# Payments request states the saga acts on
+PAID = "accepted"
+MISSING = "missing"
+
+# Answers worth asking again; any other 4xx means Payments will not take this request
+RETRYABLE_STATUS = frozenset({408, 409, 425, 429})
+
+Handler = Callable[[Any, "SagaRecord"], Any]
+Setting = Union[str, Callable[[], str]]
+
+
+class PaymentRejected(Exception):
+    """Payments answered with a status that retrying cannot fix."""
+
+
+@dataclass
+class SagaRecord:
+    id: str
+    kind: str
+    ref_id: str
+    status: str
+    attempts: int
+    payload: Dict[str, Any] = field(default_factory=dict)
+    payment_request_id: Optional[str] = None
+    last_error: Optional[str] = None
+    next_attempt_at: Optional[datetime] = None
+
+    @property
+    def amount_cents(self) -> int:
+        return int(self.payload.get("amount_cents") or 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """What a client may see: no phones, no error details."""
+        return {
+            "status": self.status,
+            "payment_request_id": self.payment_request_id,
+            "amount_cents": self.amount_cents,
+            "attempts": self.attempts,
+            "next_attempt_at": self.next_attempt_at.isoformat() if self.status == PENDING and self.next_attempt_at else None,
+        }
+
+
+_COLUMNS = "id, kind, ref_id, status, attempts, payload, payment_request_id, last_error, next_attempt_at"
+
+
+def _record(row) -> SagaRecord:
+    try:
+        payload = json.loads(row[5])
+    except (TypeError, ValueError):
+        payload = {}
+    return SagaRecord(str(row[0]), row[1], row[2], row[3], int(row[4]), payload if isinstance(payload, dict) else {}, row[6], row[7], row[8])
+
+
+_SQL_TABLES: Optional[dict] = None
+
+
+def _sql_tables() -> dict:
+    global _SQL_TABLES
+    if _SQL_TABLES is None:
+        from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text, UniqueConstraint  # type: ignore
+
+        md = MetaData()
+        _SQL_TABLES = {
+            "metadata": md,
+            "sagas": Table(
+                "payment_sagas", md,
+                Column("id", String(36), primary_key=True),
+                Column("service", String(64), nullable=False),
+                Column("kind", String(32), nullable=False),
+                Column("ref_id", String(64), nullable=False),
+                Column("status", String(16), nullable=False),
+                Column("payload", Text, nullable=False),
+                Column("attempts", Integer, nullable=False, server_default="0"),
+                Column("next_attempt_at", DateTime(timezone=True), nullable=False),
+                Column("locked_until", DateTime(timezone=True), nullable=True),
+                Column("payment_request_id", String(64), nullable=True),
+                Column("last_error", Text, nullable=True),
+                Column("created_at", DateTime(timezone=True), nullable=False),
+                Column("updated_at", DateTime(timezone=True), nullable=False),
+                UniqueConstraint("service", "kind", "ref_id", name="uq_payment_sagas_ref"),
+                Index("ix_payment_sagas_due", "service", "status", "next_attempt_at"),
+            ),
+        }
+    return _SQL_TABLES
+
+
+_stats: Dict[str, Counter] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(service: str, what: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats.setdefault(service, Counter())[what] += n
+
+
+def payment_saga_stats() -> Dict[str, Dict[str, int]]:
+    """Per service: started, requested, retried, rejected, exhausted, compensated, compensation_errors, canceled, voided, void_errors, errors."""
+    with _stats_lock:
+        return {s: dict(c) for s, c in _stats.items()}
+
+
+def _value(v: Setting) -> str:
+    return (v() if callable(v) else v) or ""
+
+
+class PaymentSaga:
+    """One service's payment handoffs (see the module docstring)."""
+
+    def __init__(
+        self,
+        service: str,
+        session_factory,
+        *,
+        base_url: Setting,
+        secret: Setting,
+        timeout_secs: float = 5.0,
+        max_attempts: int = 8,
+        retry_base_secs: float = 5,
+        retry_max_secs: float = 600,
+        lease_secs: float = 60,
+        transport: Optional[httpx.BaseTransport] = None,
+        create: bool = True,
+    ):
+        self.service = service
+        self.session_factory = session_factory
+        self._base_url = base_url
+        self._secret = secret
+        self.timeout_secs = timeout_secs
+        self.max_attempts = max_attempts
+        self.retry_base_secs = retry_base_secs
+        self.retry_max_secs = retry_max_secs
+        self.lease_secs = lease_secs
+        self.transport = transport
+        self._requested: Dict[str, Handler] = {}
+        self._failed: Dict[str, Handler] = {}
+        self._ready = not create
+        self._schema_lock = threading.Lock()
+
+    # -- setup --------------------------------------------------------------------
+
+    def on_requested(self, *kinds: str) -> Callable[[Handler], Handler]:
+        def register(fn: Handler) -> Handler:
+            for k in kinds:
+                self._requested[k] = fn
+            return fn
+
+        return register
+
+    def on_failed(self, *kinds: str) -> Callable[[Handler], Handler]:
+        def register(fn: Handler) -> Handler:
+            for k in kinds:
+                self._failed[k] = fn
+            return fn
+
+        return register
+
+    @property
+    def enabled(self) -> bool:
+        return bool(_value(self._base_url) and _value(self._secret))
+
+    def ensure_schema(self) -> None:
+        with self._schema_lock:
+            if not self._ready:
+                with self.session_factory() as db:
+                    _sql_tables()["metadata"].create_all(db.get_bind(), checkfirst=True)
+                self._ready = True
+
+    def _exec(self, sql: str, **params):
+        from sqlalchemy import text  # type: ignore
+
+        self.ensure_schema()
+        with self.session_factory() as db:
+            res = db.execute(text(sql), params)
+            out = res.fetchall() if res.returns_rows else res.rowcount
+            db.commit()
+            return out
+
+    # -- caller's transaction -----------------------------------------------------
+
+    def idempotency_key(self, kind: str, ref_id: str) -> str:
+        return f"{self.service}-{kind}-{ref_id}"[:64]
+
+    def begin(self, db, kind: str, ref_id, *, from_phone: str, to_phone: str, amount_cents: int, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Record the payment request to make for ``ref_id`` in ``db``'s transaction; returns the saga id (the existing one if already begun)."""
+        from sqlalchemy import text  # type: ignore
+
+        self.ensure_schema()
+        payload: Dict[str, Any] = {"from_phone": from_phone, "to_phone": to_phone, "amount_cents": int(amount_cents)}
+        if metadata:
+            payload["metadata"] = metadata
+        row = db.execute(
+            text(
+                """
+                INSERT INTO payment_sagas (id, service, kind, ref_id, status, payload, attempts, next_attempt_at, created_at, updated_at)
+                VALUES (:id, :s, :k, :r, 'pending', :p, 0, clock_timestamp(), clock_timestamp(), clock_timestamp())
+                ON CONFLICT (service, kind, ref_id) DO NOTHING
+                RETURNING id
+                """
+            ),
+            {"id": str(uuid.uuid4()), "s": self.service, "k": kind, "r": str(ref_id), "p": json.dumps(payload, separators=(",", ":"))},
+        ).first()
+        if row is None:
+            return str(db.execute(
+                text("SELECT id FROM payment_sagas WHERE service = :s AND kind = :k AND ref_id = :r"),
+                {"s": self.service, "k": kind, "r": str(ref_id)},
+            ).scalar_one())
+        _count(self.service, "started")
+        return str(row[0])
+
+    def status(self, db, kind: str, ref_id) -> Optional[SagaRecord]:
+        from sqlalchemy import text  # type: ignore
+
+        self.ensure_schema()
+        row = db.execute(
+            text(f"SELECT {_COLUMNS} FROM payment_sagas WHERE service = :s AND kind = :k AND ref_id = :r"),
+            {"s": self.service, "k": kind, "r": str(ref_id)},
+        ).first()
+        return _record(row) if row else None
+
+    def cancel(self, db, kind: str, ref_id) -> bool:
+        """Stop a pending saga in ``db``'s transaction; False if there is none, it finished, or a request is in flight.
+
+        A saga never sent is ``canceled`` outright; one sent before is withdrawn first (``voiding``).
+        """
+        from sqlalchemy import text  # type: ignore
+
+        self.ensure_schema()
+        row = db.execute(
+            text(
+                """
+                UPDATE payment_sagas
+                   SET status = CASE WHEN attempts = 0 THEN 'canceled' ELSE 'voiding' END,
+                       attempts = 0, next_attempt_at = clock_timestamp(), updated_at = clock_timestamp()
+                 WHERE service = :s AND kind = :k AND ref_id = :r AND status = 'pending'
+                   AND (locked_until IS NULL OR locked_until <= clock_timestamp())
+                RETURNING id
+                """
+            ),
+            {"s": self.service, "k": kind, "r": str(ref_id)},
+        ).first()
+        if row is not None:
+            _count(self.service, "canceled")
+        return row is not None
+
+    def void(self, db, kind: str, ref_id) -> bool:
+        """Withdraw the Payments request of a ``requested`` saga in ``db``'s transaction (sent by ``process_due``); False if there is none."""
+        from sqlalchemy import text  # type: ignore
+
+        self.ensure_schema()
+        row = db.execute(
+            text(
+                """
+                UPDATE payment_sagas SET status = 'voiding', attempts = 0, next_attempt_at = clock_timestamp(), updated_at = clock_timestamp()
+                 WHERE service = :s AND kind = :k AND ref_id = :r AND status = 'requested'
+                RETURNING id
+                """
+            ),
+            {"s": self.service, "k": kind, "r": str(ref_id)},
+        ).first()
+        return row is not None
+
+    # -- executor -----------------------------------------------------------------
+
+    def get(self, saga_id: str) -> Optional[SagaRecord]:
+        rows = self._exec(f"SELECT {_COLUMNS} FROM payment_sagas WHERE id = :id", id=str(saga_id))
+        return _record(rows[0]) if rows else None
+
+    def _claim(self, limit: int, saga_id: Optional[str] = None):
+        only = "AND id = :id" if saga_id is not None else ""
+        rows = self._exec(
+            f"""
+            UPDATE payment_sagas
+               SET attempts = attempts + CASE WHEN status IN ('pending', 'voiding') THEN 1 ELSE 0 END,
+                   locked_until = clock_timestamp() + make_interval(secs => :lease),
+                   updated_at = clock_timestamp()
+             WHERE id IN (
+                SELECT id FROM payment_sagas
+                 WHERE service = :s {only}
+                   AND status IN ('pending', 'compensating', 'voiding')
+                   AND next_attempt_at <= clock_timestamp()
+                   AND (locked_until IS NULL OR locked_until <= clock_timestamp())
+                 ORDER BY next_attempt_at
+                 LIMIT :n
+                 FOR UPDATE SKIP LOCKED
+             )
+            RETURNING {_COLUMNS}
+            """,
+            s=self.service, id=str(saga_id), n=int(limit), lease=float(self.lease_secs),
+        )
+        return [_record(r) for r in rows]
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.retry_max_secs, self.retry_base_secs * (2 ** max(0, attempts - 1)))
+
+    def _send(self, rec: SagaRecord) -> str:
+        base, secret = _value(self._base_url), _value(self._secret)
+        if not base or not secret:
+            raise RuntimeError("payments not configured")
+        headers = sign_internal_request_headers(rec.payload, secret)
+        headers["X-Idempotency-Key"] = self.idempotency_key(rec.kind, rec.ref_id)
+        kw: Dict[str, Any] = {"timeout": self.timeout_secs}
+        if self.transport is not None:
+            kw["transport"] = self.transport
+        with httpx.Client(**kw) as client:
+            r = client.post(f"{base.rstrip('/')}/internal/requests", headers=headers, json=rec.payload)
+        if r.status_code < 300:
+            pr_id = (r.json() or {}).get("id")
+            if not pr_id:
+                raise ValueError("no request id in the response")
+            return str(pr_id)
+        if r.status_code < 500 and r.status_code not in RETRYABLE_STATUS:
+            raise PaymentRejected(f"HTTP {r.status_code}")
+        raise RuntimeError(f"HTTP {r.status_code}")
+
+    def _send_void(self, rec: SagaRecord) -> Tuple[str, Optional[str]]:
+        """Cancel the request made under this saga's idempotency key at Payments.
+
+        Returns ``(status afterwards, request id)``: ``canceled`` unless it was settled first,
+        ``("missing", None)`` when Payments never created one.
+        """
+        base, secret = _value(self._base_url), _value(self._secret)
+        if not base or not secret:
+            raise RuntimeError("payments not configured")
+        body = {"idempotency_key": self.idempotency_key(rec.kind, rec.ref_id)}
+        kw: Dict[str, Any] = {"timeout": self.timeout_secs}
+        if self.transport is not None:
+            kw["transport"] = self.transport
+        with httpx.Client(**kw) as client:
+            r = client.post(f"{base.rstrip('/')}/internal/requests/cancel", headers=sign_internal_request_headers(body, secret), json=body)
+        if r.status_code == 404:
+            return MISSING, None
+        if r.status_code < 300:
+            js = r.json() or {}
+            return str(js.get("status") or CANCELED), (str(js["id"]) if js.get("id") else None)
+        raise RuntimeError(f"HTTP {r.status_code}")
+
+    def _retry(self, rec: SagaRecord, err: str, status: str = PENDING) -> None:
+        self._exec(
+            """
+            UPDATE payment_sagas
+               SET status = :st, locked_until = NULL, last_error = :err, updated_at = clock_timestamp(),
+                   next_attempt_at = clock_timestamp() + make_interval(secs => :d)
+             WHERE id = :id AND status IN ('pending', 'compensating', 'voiding')
+            """,
+            id=rec.id, st=status, err=err, d=float(self.backoff(rec.attempts)),
+        )
+
+    def _finish(self, rec: SagaRecord, pr_id: str) -> str:
+        from sqlalchemy import text  # type: ignore
+
+        with self.session_factory() as db:
+            won = db.execute(
+                text(
+                    """
+                    UPDATE payment_sagas
+                       SET status = 'requested', payment_request_id = :pr, locked_until = NULL, last_error = NULL,
+                           updated_at = clock_timestamp()
+                     WHERE id = :id AND status IN ('pending', 'compensating')
+                    RETURNING id
+                    """
+                ),
+                {"id": rec.id, "pr": pr_id},
+            ).first()
+            if won is None:
+                # Another worker finished it after our lease ran out
+                return "stale"
+            rec.status, rec.payment_request_id = REQUESTED, pr_id
+            handler = self._requested.get(rec.kind)
+            if handler is not None and handler(db, rec) is False:
+                # Canceled while the request was in flight: withdraw it, still under this worker's lease
+                db.execute(
+                    text(
+                        """
+                        UPDATE payment_sagas
+                           SET status = 'voiding', attempts = 0, updated_at = clock_timestamp(),
+                               locked_until = clock_timestamp() + make_interval(secs => :lease)
+                         WHERE id = :id
+                        """
+                    ),
+                    {"id": rec.id, "lease": float(self.lease_secs)},
+                )
+                rec.status, rec.attempts = VOIDING, 0
+            db.commit()
+        _count(self.service, "requested")
+        return rec.status
+
+    def _void(self, rec: SagaRecord) -> str:
+        try:
+            outcome, pr_id = self._send_void(rec)
+        except Exception as e:
+            err = f"void: {type(e).__name__}: {e}"[:1000]
+            log.warning("payment saga %s/%s: withdrawing its request failed: %s", self.service, rec.id, err)
+            self._retry(rec, err, VOIDING)
+            _count(self.service, "void_errors")
+            return VOIDING
+        pr_id = rec.payment_request_id or pr_id
+        if outcome == MISSING and pr_id is None:
+            # Canceled after attempts that never reached Payments
+            status, err = CANCELED, None
+        else:
+            status, err = VOIDED, (None if outcome == CANCELED else f"request already {outcome}")
+            if err:
+                log.warning("payment saga %s/%s: request %s was already %s when withdrawn", self.service, rec.id, pr_id, outcome)
+        self._exec(
+            """
+            UPDATE payment_sagas
+               SET status = :st, payment_request_id = :pr, locked_until = NULL, last_error = :err, updated_at = clock_timestamp()
+             WHERE id = :id AND status = 'voiding'
+            """,
+            id=rec.id, st=status, pr=pr_id, err=err,
+        )
+        rec.status, rec.payment_request_id = status, pr_id
+        if status == VOIDED:
+            _count(self.service, "voided")
+        return status
+
+    def _compensate(self, rec: SagaRecord, err: Optional[str] = None, withdraw: bool = True) -> str:
+        from sqlalchemy import text  # type: ignore
+
+        if withdraw:
+            # The lost answers may have created the request: withdraw it before releasing what it pays for
+            try:
+                outcome, pr_id = self._send_void(rec)
+            except Exception as e:
+                log.warning("payment saga %s/%s: withdrawing before compensation failed: %s", self.service, rec.id, e)
+                self._retry(rec, f"withdraw: {type(e).__name__}: {e}"[:1000], COMPENSATING)
+                _count(self.service, "void_errors")
+                return COMPENSATING
+            if outcome == PAID and pr_id:
+                log.warning("payment saga %s/%s: request %s was paid before it could be withdrawn", self.service, rec.id, pr_id)
+                outcome = self._finish(rec, pr_id)
+                return self._void(rec) if outcome == VOIDING else outcome
+        try:
+            with self.session_factory() as db:
+                won = db.execute(
+                    text(
+                        """
+                        UPDATE payment_sagas
+                           SET status = 'compensated', locked_until = NULL, last_error = COALESCE(:err, last_error),
+                               updated_at = clock_timestamp()
+                         WHERE id = :id AND status IN ('pending', 'compensating')
+                        RETURNING id
+                        """
+                    ),
+                    {"id": rec.id, "err": err},
+                ).first()
+                if won is None:
+                    return "stale"
+                rec.status = COMPENSATED
+                handler = self._failed.get(rec.kind)
+                if handler is not None:
+                    handler(db, rec)
+                db.commit()
+        except Exception as e:
+            log.warning("payment saga %s/%s compensation failed", self.service, rec.id, exc_info=True)
+            self._retry(rec, err or f"compensation: {type(e).__name__}: {e}"[:1000], COMPENSATING)
+            _count(self.service, "compensation_errors")
+            return COMPENSATING
+        _count(self.service, "compensated")
+        return COMPENSATED
+
+    def _run(self, rec: SagaRecord) -> str:
+        if rec.status == VOIDING:
+            return self._void(rec)
+        if rec.status == COMPENSATING or rec.attempts > self.max_attempts:
+            # A worker died between giving up and compensating
+            return self._compensate(rec)
+        try:
+            pr_id = self._send(rec)
+        except PaymentRejected as e:
+            log.warning("payment saga %s/%s rejected by Payments: %s", self.service, rec.id, e)
+            _count(self.service, "rejected")
+            return self._compensate(rec, f"rejected: {e}", withdraw=False)
+        except Exception as e:
+            err = f"{type(e).__name__}: {e}"[:1000]
+            if rec.attempts >= self.max_attempts:
+                log.error("payment saga %s/%s gave up after %d attempts: %s", self.service, rec.id, rec.attempts, err)
+                _count(self.service, "exhausted")
+                return self._compensate(rec, err)
+            log.warning("payment saga %s/%s attempt %d failed: %s", self.service, rec.id, rec.attempts, err)
+            self._retry(rec, err)
+            _count(self.service, "retried")
+            return "retried"
+        try:
+            outcome = self._finish(rec, pr_id)
+        except Exception as e:
+            # Payments has the request; the retry gets the same id back under the idempotency key
+            log.warning("payment saga %s/%s: recording request %s failed", self.service, rec.id, pr_id, exc_info=True)
+            self._retry(rec, f"{type(e).__name__}: {e}"[:1000])
+            _count(self.service, "errors")
+            return "retried"
+        return self._void(rec) if outcome == VOIDING else outcome
+
+    def dispatch(self, saga_id: str) -> Optional[SagaRecord]:
+        """Run one saga now if it is due and unclaimed; returns its record afterwards (None if it could not be read)."""
+        try:
+            for rec in self._claim(1, saga_id):
+                self._run(rec)
+            return self.get(saga_id)
+        except Exception:
+            # The sweeper picks it up; the booking itself is already committed
+            log.warning("payment saga %s/%s: dispatch failed", self.service, saga_id, exc_info=True)
+            _count(self.service, "errors")
+            return None
+
+    def process_due(self, limit: int = 100) -> Dict[str, int]:
+        """Run due and lease-expired sagas (the sweeper job); returns outcome counts."""
+        out: Counter = Counter()
+        for rec in self._claim(limit):
+            out[self._run(rec)] += 1
+        return dict(out)
+
+
+def register_prometheus_collector(registry=None) -> bool:
+    """Expose ``payment_saga_events_total{service,outcome}``."""
+    try:
+        from prometheus_client import REGISTRY  # type: ignore
+        from prometheus_client.core import CounterMetricFamily  # type: ignore
+    except Exception:
+        return False
+
+    class _SagaCollector:
+        def collect(self):
+            m = CounterMetricFamily("payment_saga_events", "Payment handoff saga events by outcome", labels=["service", "outcome"])
+            for service, counts in payment_saga_stats().items():
+                for outcome, n in counts.items():
+                    m.add_metric([service, outcome], float(n))
+            return [m]
+
+    try:
+        (registry or REGISTRY).register(_SagaCollector())
+    except ValueError:
+        return True
+    except Exception:
+        return False
+    return True
+
+
+__all__ = [
+    "CANCELED",
+    "COMPENSATED",
+    "COMPENSATING",
+    "PENDING",
+    "PaymentRejected",
+    "PaymentSaga",
+    "REQUESTED",
+    "RETRYABLE_STATUS",
+    "SagaRecord",
+    "payment_saga_stats",
+    "register_prometheus_collector",
+]
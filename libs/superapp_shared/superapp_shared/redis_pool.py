@@ -0,0 +1,379 @@
+"""
+Process-wide Redis client registry.
+
+Hot paths (OTP, internal HMAC replay checks, event publishing) used to call
+``redis.from_url`` per operation, which builds a fresh connection pool and a
+new TCP connection every time. The registry keeps one pool per URL (and per
+event loop for asyncio clients) so connections are reused, health-checked and
+retried with exponential backoff.
+
+Usage::
+
+    from superapp_shared.redis_pool import get_redis, install_redis_lifecycle
+
+    r = get_redis(settings.REDIS_URL)      # None when redis is unavailable
+    install_redis_lifecycle(app)           # warm up on startup, close on shutdown
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+    import redis  # type: ignore
+    from redis.backoff import ExponentialBackoff  # type: ignore
+    from redis.retry import Retry  # type: ignore
+except Exception:  # pragma: no cover
+    redis = None  # type: ignore
+    ExponentialBackoff = None  # type: ignore
+    Retry = None  # type: ignore
+
+try:
+    import redis.asyncio as aioredis  # type: ignore
+    from redis.asyncio.retry import Retry as AsyncRetry  # type: ignore
+except Exception:  # pragma: no cover
+    aioredis = None  # type: ignore
+    AsyncRetry = None  # type: ignore
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def redact_url(url: str) -> str:
+    """Strip credentials from a Redis URL so it can be used as a metric label."""
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        if parts.port:
+            host = f"{host}:{parts.port}"
+        return urlunsplit((parts.scheme, host, parts.path, "", ""))
+    except Exception:
+        return "redis://?"
+
+
+class RedisClientRegistry:
+    """Per-URL connection pools for sync and asyncio Redis clients.
+
+    - One ``ConnectionPool`` per (url, decode_responses); asyncio pools are
+      additionally keyed by the running event loop because they cannot be
+      shared across loops.
+    - Commands retry on connection errors/timeouts with exponential backoff;
+      idle connections are health-checked before reuse.
+    - When a URL fails its health check, callers get ``None`` until the
+      reconnect backoff elapses (fail-open, like the previous per-call code).
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections: Optional[int] = None,
+        health_check_interval: Optional[int] = None,
+        socket_timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        backoff_base: float = 0.05,
+        backoff_cap: float = 2.0,
+        reconnect_max_secs: float = 30.0,
+    ):
+        self.max_connections = max_connections if max_connections is not None else _env_int("REDIS_POOL_MAX_CONNECTIONS", 50)
+        self.health_check_interval = (
+            health_check_interval if health_check_interval is not None else _env_int("REDIS_HEALTH_CHECK_SECS", 30)
+        )
+        self.socket_timeout = socket_timeout if socket_timeout is not None else _env_float("REDIS_SOCKET_TIMEOUT_SECS", 2.0)
+        self.retries = retries if retries is not None else _env_int("REDIS_RETRIES", 3)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.reconnect_max_secs = reconnect_max_secs
+        self._lock = threading.Lock()
+        self._sync: Dict[Tuple[str, bool], Any] = {}
+        self._async: Dict[Tuple[str, bool, int], Any] = {}
+        # url -> (consecutive_failures, retry_not_before)
+        self._down: Dict[str, Tuple[int, float]] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    # -- pool construction -------------------------------------------------
+
+    def _pool_kwargs(self, retry_cls) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {
+            "max_connections": self.max_connections,
+            "health_check_interval": self.health_check_interval,
+            "socket_timeout": self.socket_timeout,
+            "socket_connect_timeout": self.socket_timeout,
+            "socket_keepalive": True,
+            "retry_on_timeout": True,
+        }
+        if retry_cls is not None and ExponentialBackoff is not None and self.retries > 0:
+            kwargs["retry"] = retry_cls(ExponentialBackoff(cap=self.backoff_cap, base=self.backoff_base), self.retries)
+        return kwargs
+
+    def _count(self, url: str, name: str) -> None:
+        c = self._counters.setdefault(redact_url(url), {})
+        c[name] = c.get(name, 0) + 1
+
+    def _is_down(self, url: str) -> bool:
+        state = self._down.get(url)
+        return bool(state and time.monotonic() < state[1])
+
+    def mark_failed(self, url: str) -> None:
+        """Record a failure for ``url``; callers are short-circuited until the backoff elapses."""
+        with self._lock:
+            failures = self._down.get(url, (0, 0.0))[0] + 1
+            delay = min(self.reconnect_max_secs, self.backoff_base * (2 ** failures))
+            self._down[url] = (failures, time.monotonic() + delay)
+            self._count(url, "failures")
+
+    def mark_ok(self, url: str) -> None:
+        with self._lock:
+            self._down.pop(url, None)
+
+    def client(self, url: Optional[str], *, decode_responses: bool = False):
+        """Return a shared ``redis.Redis`` bound to the pool for ``url`` (or None)."""
+        if not url or redis is None:
+            return None
+        if self._is_down(url):
+            return None
+        key = (url, decode_responses)
+        pool = self._sync.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._sync.get(key)
+                if pool is None:
+                    try:
+                        pool = redis.ConnectionPool.from_url(
+                            url, decode_responses=decode_responses, **self._pool_kwargs(Retry)
+                        )
+                    except Exception:
+                        return None
+                    self._sync[key] = pool
+                    self._count(url, "pools_created")
+        return redis.Redis(connection_pool=pool)
+
+    def async_client(self, url: Optional[str], *, decode_responses: bool = False):
+        """Return a shared ``redis.asyncio.Redis`` for the running loop (or None)."""
+        if not url or aioredis is None:
+            return None
+        if self._is_down(url):
+            return None
+        try:
+            loop_id = id(asyncio.get_running_loop())
+        except RuntimeError:
+            loop_id = 0
+        key = (url, decode_responses, loop_id)
+        pool = self._async.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._async.get(key)
+                if pool is None:
+                    try:
+                        pool = aioredis.ConnectionPool.from_url(
+                            url, decode_responses=decode_responses, **self._pool_kwargs(AsyncRetry)
+                        )
+                    except Exception:
+                        return None
+                    self._async[key] = pool
+                    self._count(url, "pools_created")
+        return aioredis.Redis(connection_pool=pool)
+
+    # -- health ------------------------------------------------------------
+
+    def urls(self) -> List[str]:
+        seen: List[str] = []
+        for url, _ in list(self._sync.keys()):
+            if url not in seen:
+                seen.append(url)
+        for url, _, _ in list(self._async.keys()):
+            if url not in seen:
+                seen.append(url)
+        return seen
+
+    def check_health(self, url: Optional[str] = None) -> Dict[str, bool]:
+        """PING every known URL (or just ``url``); updates the reconnect backoff state."""
+        targets = [url] if url else self.urls()
+        out: Dict[str, bool] = {}
+        for u in targets:
+            if not u:
+                continue
+            ok = False
+            # Bypass the down-check so a recovered server is noticed.
+            with self._lock:
+                self._down.pop(u, None)
+            r = self.client(u)
+            if r is not None:
+                try:
+                    ok = bool(r.ping())
+                except Exception:
+                    ok = False
+            if ok:
+                self.mark_ok(u)
+            else:
+                self.mark_failed(u)
+            out[redact_url(u)] = ok
+        return out
+
+    # -- metrics -----------------------------------------------------------
+
+    @staticmethod
+    def _pool_stats(pool) -> Dict[str, int]:
+        created = int(getattr(pool, "_created_connections", 0) or 0)
+        available = len(getattr(pool, "_available_connections", []) or [])
+        in_use = len(getattr(pool, "_in_use_connections", []) or [])
+        return {
+            "created_connections": created,
+            "available_connections": available,
+            "in_use_connections": in_use,
+            "max_connections": int(getattr(pool, "max_connections", 0) or 0),
+        }
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Snapshot of pool metrics, one entry per pool (credentials redacted)."""
+        rows: List[Dict[str, Any]] = []
+        for (url, decode), pool in list(self._sync.items()):
+            row = {"url": redact_url(url), "kind": "sync", "decode_responses": decode}
+            row.update(self._pool_stats(pool))
+            row.update(self._counters.get(redact_url(url), {}))
+            row["healthy"] = not self._is_down(url)
+            rows.append(row)
+        for (url, decode, _), pool in list(self._async.items()):
+            row = {"url": redact_url(url), "kind": "async", "decode_responses": decode}
+            row.update(self._pool_stats(pool))
+            row.update(self._counters.get(redact_url(url), {}))
+            row["healthy"] = not self._is_down(url)
+            rows.append(row)
+        return rows
+
+    def total_connections(self, url: Optional[str] = None) -> int:
+        """Sum of connections created across pools (optionally for one URL)."""
+        total = 0
+        for row in self.stats():
+            if url is None or row["url"] == redact_url(url):
+                total += int(row["created_connections"])
+        return total
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def close(self) -> None:
+        """Disconnect and drop all sync pools (async pools are dropped too)."""
+        with self._lock:
+            pools = list(self._sync.values())
+            self._sync.clear()
+            self._async.clear()
+            self._down.clear()
+        for pool in pools:
+            try:
+                pool.disconnect()
+            except Exception:
+                pass
+
+    async def aclose(self) -> None:
+        """Disconnect async pools owned by the running loop, then close sync pools."""
+        try:
+            loop_id = id(asyncio.get_running_loop())
+        except RuntimeError:
+            loop_id = 0
+        with self._lock:
+            mine = [(k, p) for k, p in self._async.items() if k[2] == loop_id]
+            for k, _ in mine:
+                self._async.pop(k, None)
+        for _, pool in mine:
+            try:
+                await pool.disconnect()
+            except Exception:
+                pass
+        self.close()
+
+
+_registry = RedisClientRegistry()
+
+
+def get_registry() -> RedisClientRegistry:
+    return _registry
+
+
+def get_redis(url: Optional[str], *, decode_responses: bool = False):
+    return _registry.client(url, decode_responses=decode_responses)
+
+
+def get_async_redis(url: Optional[str], *, decode_responses: bool = False):
+    return _registry.async_client(url, decode_responses=decode_responses)
+
+
+def redis_pool_stats() -> List[Dict[str, Any]]:
+    return _registry.stats()
+
+
+def install_redis_lifecycle(app, *urls: Optional[str]) -> None:
+    """Warm pools for ``urls`` on startup and close every pool on shutdown.
+
+    Also registers a Prometheus collector (when prometheus_client is
+    installed) exposing ``redis_pool_*`` gauges on the app's /metrics.
+    """
+
+    async def _startup():
+        for u in urls:
+            if u:
+                _registry.check_health(u)
+
+    async def _shutdown():
+        await _registry.aclose()
+
+    app.add_event_handler("startup", _startup)
+    app.add_event_handler("shutdown", _shutdown)
+    register_prometheus_collector()
+
+
+def register_prometheus_collector(registry=None) -> bool:
+    """Expose pool stats as Prometheus gauges; no-op without prometheus_client.
+
+    Re-registering after the collector is already present is harmless.
+    """
+    try:
+        from prometheus_client import REGISTRY  # type: ignore
+        from prometheus_client.core import GaugeMetricFamily  # type: ignore
+    except Exception:
+        return False
+
+    class _PoolCollector:
+        def collect(self):
+            fams = {
+                name: GaugeMetricFamily(f"redis_pool_{name}", f"Redis pool {name.replace('_', ' ')}", labels=["url", "kind"])
+                for name in ("created_connections", "available_connections", "in_use_connections", "max_connections")
+            }
+            for row in _registry.stats():
+                for name, fam in fams.items():
+                    fam.add_metric([row["url"], row["kind"]], float(row.get(name, 0)))
+            return list(fams.values())
+
+    try:
+        (registry or REGISTRY).register(_PoolCollector())
+    except ValueError:
+        # Already registered (duplicate timeseries)
+        return True
+    except Exception:
+        return False
+    return True
+
+
+__all__ = [
+    "RedisClientRegistry",
+    "get_registry",
+    "get_redis",
+    "get_async_redis",
+    "redis_pool_stats",
+    "install_redis_lifecycle",
+    "register_prometheus_collector",
+    "redact_url",
+]
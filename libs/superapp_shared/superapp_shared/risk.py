@@ -0,0 +1,1000 @@
+"""
+Risk scoring engine: rolling features, declarative rules, shadow mode.
+
+Services used to hard-code their fraud heuristics (payments summed a fixed
+score from env integers, taxi counted recent rides inline). Here:
+
+- a feature store keeps rolling per-entity aggregates (``user``, ``device``,
+  ``cp`` = counterparty) over named windows, fed with ``RiskEvent``s from the
+  ledger / ride flows: ``count``, ``amount``, ``<kind>_count`` and distinct
+  counts (``user.counterparties``, ``user.devices``, ``device.users``,
+  ``cp.users``), exposed to rules as e.g. ``user.count_1h`` or
+  ``device.users_24h``,
+- rules are data: a rule set is a JSON document of ``when`` expressions (a
+  small, safe expression language compiled once), scores and actions, and a
+  ``RuleRegistry`` reloads it from its source without a restart (a bad
+  document keeps the last good one),
+- shadow rule sets are evaluated on the same features next to the active one
+  and only recorded; the whole engine can also run in ``shadow`` mode,
+- every decision carries an explanation (rules hit with their scores, the
+  feature values the rule set reads, shadow verdicts) that is handed to a
+  ``DecisionRecorder`` for audit storage,
+- ``replay`` runs recorded events through candidate rule sets and reports
+  decisions per second and disagreements.
+
+Rule set document::
+
+    {
+      "version": "2025-11-02.1",
+      "thresholds": {"flag": 60, "block": 100},
+      "rules": [
+        {"id": "new_account", "when": "account_age_days < 1", "score": 30},
+        {"id": "velocity", "when": "user.count_1h >= 10 and amount_cents > 100000",
+         "score": "min(80, user.count_1h * 5)", "reason": "burst of payments"},
+        {"id": "device_farm", "when": "device.users_24h > 5", "action": "block"}
+      ]
+    }
+
+Expressions support numbers, strings, ``and``/``or``/``not``, comparisons
+(incl. ``in``), arithmetic, ``x if c else y``, lists and ``min``/``max``/
+``abs``/``round``. Unknown names read as ``0``. The verdict is ``block`` if a
+rule says so or the score reaches ``block``; else ``allow`` if a rule says so;
+else ``flag`` if a rule says so or the score reaches ``flag``; else ``allow``.
+
+Usage::
+
+    from superapp_shared.risk import MemoryFeatureStore, RiskEngine, RiskEvent, RuleRegistry
+
+    engine = RiskEngine("payments", RuleRegistry(load_rules), MemoryFeatureStore())
+    d = engine.evaluate("p2p_transfer", user_id=uid, amount_cents=500, facts={"kyc_level": 1})
+    if d.blocked:
+        raise HTTPException(403, "risk_blocked")
+    engine.observe(RiskEvent("transfer", user_id=uid, amount_cents=500, counterparty=to_uid))
+"""
+from __future__ import annotations
+
+import ast
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from .redis_pool import get_redis
+
+
+log = logging.getLogger(__name__)
+
+ACTIONS = ("allow", "flag", "block")
+DEFAULT_WINDOWS = {"10m": 600, "1h": 3600, "24h": 86400}
+BUCKETS_PER_WINDOW = 60
+MAX_EXPR_LEN = 1000
+
+
+class RuleError(ValueError):
+    """A rule set document or expression is invalid."""
+
+
+# --- expression language ------------------------------------------------------
+
+_FUNCS = {"min": min, "max": max, "abs": abs, "round": round}
+_GLOBALS = {"__builtins__": {}, **_FUNCS}
+_ALLOWED = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.IfExp, ast.List, ast.Tuple, ast.Load,
+)
+
+
+def _dotted(node: ast.AST) -> Optional[str]:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+class _Compiler(ast.NodeTransformer):
+    """Whitelists the syntax and rewrites (dotted) names into feature lookups ``F["user.count_1h"]``."""
+
+    def __init__(self) -> None:
+        self.names: set = set()
+
+    def generic_visit(self, node):
+        if not isinstance(node, _ALLOWED):
+            raise RuleError(f"unsupported syntax: {type(node).__name__}")
+        return super().generic_visit(node)
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, str, bool, type(None))):
+            raise RuleError("unsupported constant")
+        return node
+
+    def _lookup(self, name: Optional[str], node):
+        if not name or any(p.startswith("_") for p in name.split(".")):
+            raise RuleError(f"invalid name: {name!r}")
+        self.names.add(name)
+        ref = ast.Subscript(value=ast.Name(id="F", ctx=ast.Load()), slice=ast.Constant(name), ctx=ast.Load())
+        return ast.copy_location(ref, node)
+
+    def visit_Name(self, node):
+        return self._lookup(node.id, node)
+
+    def visit_Attribute(self, node):
+        return self._lookup(_dotted(node), node)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _FUNCS or node.keywords:
+            raise RuleError("only min/max/abs/round calls are allowed")
+        node.args = [self.visit(a) for a in node.args]
+        return node
+
+
+@dataclass
+class Expr:
+    source: str
+    names: frozenset
+    _code: Any = field(repr=False)
+
+    def __call__(self, features: Mapping[str, Any]) -> Any:
+        return eval(self._code, _GLOBALS, {"F": features})  # noqa: S307 - whitelisted AST only
+
+
+def compile_expr(source: Any) -> Expr:
+    """Compile a rule expression; numbers compile to constants."""
+    if isinstance(source, bool) or not isinstance(source, (str, int, float)):
+        raise RuleError(f"expression must be a string or number, got {type(source).__name__}")
+    text = str(source)
+    if len(text) > MAX_EXPR_LEN:
+        raise RuleError("expression too long")
+    try:
+        tree = ast.parse(text, mode="eval")
+    except SyntaxError as e:
+        raise RuleError(f"syntax error in {text!r}: {e.msg}") from None
+    comp = _Compiler()
+    tree = ast.fix_missing_locations(comp.visit(tree))
+    return Expr(text, frozenset(comp.names), compile(tree, "<risk-rule>", "eval"))
+
+
+class Features(dict):
+    """Feature values; unknown names read as 0."""
+
+    def __missing__(self, key):
+        return 0
+
+
+# --- rules ----------------------------------------------------------------------
+
+
+@dataclass
+class Rule:
+    id: str
+    when: Expr
+    score: Expr
+    action: Optional[str] = None
+    reason: str = ""
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> "Rule":
+        rid = str(d.get("id") or "").strip()
+        if not rid:
+            raise RuleError("rule without id")
+        action = d.get("action")
+        if action is not None and action not in ACTIONS:
+            raise RuleError(f"rule {rid}: action must be one of {ACTIONS}")
+        try:
+            return cls(rid, compile_expr(d.get("when", "True")), compile_expr(d.get("score", 0)), action, str(d.get("reason") or ""))
+        except RuleError as e:
+            raise RuleError(f"rule {rid}: {e}") from None
+
+
+@dataclass
+class Hit:
+    rule: str
+    score: float
+    action: Optional[str]
+    reason: str
+
+    def to_dict(self) -> dict:
+        out = {"rule": self.rule, "score": self.score}
+        if self.action:
+            out["action"] = self.action
+        if self.reason:
+            out["reason"] = self.reason
+        return out
+
+
+@dataclass
+class Verdict:
+    version: str
+    action: str
+    score: float
+    hits: List[Hit]
+    errors: List[str]
+
+
+class RuleSet:
+    def __init__(self, version: str, rules: Sequence[Rule], flag_score: float = 60, block_score: float = 100, source: Optional[dict] = None):
+        self.version = version
+        self.rules = list(rules)
+        self.flag_score = float(flag_score)
+        self.block_score = float(block_score)
+        self.source = source or {}
+        self.names = frozenset().union(*[r.when.names | r.score.names for r in self.rules]) if self.rules else frozenset()
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> "RuleSet":
+        if not isinstance(d, Mapping):
+            raise RuleError("rule set must be an object")
+        raw_rules = d.get("rules")
+        if not isinstance(raw_rules, list):
+            raise RuleError("rule set needs a 'rules' list")
+        rules = [Rule.from_dict(r) for r in raw_rules if not (isinstance(r, Mapping) and r.get("enabled") is False)]
+        ids = [r.id for r in rules]
+        if len(ids) != len(set(ids)):
+            raise RuleError("duplicate rule ids")
+        th = d.get("thresholds") or {}
+        try:
+            flag, block = float(th.get("flag", 60)), float(th.get("block", 100))
+        except (TypeError, ValueError):
+            raise RuleError("thresholds must be numbers") from None
+        version = str(d.get("version") or hashlib.sha256(json.dumps(d, sort_keys=True, default=str).encode()).hexdigest()[:12])
+        return cls(version, rules, flag, block, dict(d))
+
+    def evaluate(self, features: Mapping[str, Any]) -> Verdict:
+        score = 0.0
+        hits: List[Hit] = []
+        errors: List[str] = []
+        forced = set()
+        for r in self.rules:
+            try:
+                if not r.when(features):
+                    continue
+                s = float(r.score(features) or 0)
+            except Exception as e:
+                errors.append(f"{r.id}: {type(e).__name__}")
+                continue
+            score += s
+            hits.append(Hit(r.id, s, r.action, r.reason))
+            if r.action:
+                forced.add(r.action)
+        if "block" in forced or score >= self.block_score:
+            action = "block"
+        elif "allow" in forced:
+            action = "allow"
+        elif "flag" in forced or score >= self.flag_score:
+            action = "flag"
+        else:
+            action = "allow"
+        return Verdict(self.version, action, score, hits, errors)
+
+
+def _fingerprint(doc: Any) -> str:
+    return hashlib.sha256(json.dumps(doc, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class RuleRegistry:
+    """Active + shadow rule sets, reloaded from ``loader`` at most every ``reload_secs``.
+
+    ``loader()`` returns a rule set document, or ``{"active": doc, "shadow": [doc, ...]}``,
+    or ``None`` (keep the fallback). A document that fails to compile keeps the previous rules.
+    """
+
+    def __init__(self, loader: Optional[Callable[[], Any]] = None, *, fallback: Optional[dict] = None, reload_secs: float = 10.0, clock: Callable[[], float] = time.monotonic):
+        self.loader = loader
+        self.reload_secs = float(reload_secs)
+        self.clock = clock
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error: Optional[str] = None
+        self._fallback = fallback or {"version": "empty", "rules": []}
+        self._lock = threading.Lock()
+        self._fp: Optional[str] = None
+        self._checked = float("-inf")
+        self.active: RuleSet = RuleSet.from_dict(self._fallback)
+        self.shadow: List[RuleSet] = []
+
+    def current(self) -> Tuple[RuleSet, List[RuleSet]]:
+        if self.loader is not None and self.clock() - self._checked >= self.reload_secs:
+            self.reload()
+        return self.active, self.shadow
+
+    def reload(self, force: bool = False) -> bool:
+        """Re-read the source; returns True if the rules changed."""
+        with self._lock:
+            self._checked = self.clock()
+            try:
+                doc = self.loader() if self.loader is not None else None
+            except Exception as e:
+                self.reload_errors += 1
+                self.last_error = f"loader: {type(e).__name__}: {e}"
+                log.warning("risk rules loader failed", exc_info=True)
+                return False
+            if doc is None:
+                doc = self._fallback
+            if not (isinstance(doc, Mapping) and "active" in doc):
+                doc = {"active": doc, "shadow": []}
+            fp = _fingerprint(doc)
+            if fp == self._fp and not force:
+                return False
+            try:
+                active = RuleSet.from_dict(doc["active"] or self._fallback)
+                shadow = [RuleSet.from_dict(s) for s in doc.get("shadow") or []]
+            except RuleError as e:
+                self.reload_errors += 1
+                self.last_error = str(e)
+                self._fp = fp  # do not recompile the same bad document every check
+                log.warning("risk rules rejected, keeping version %s: %s", self.active.version, e)
+                return False
+            self.active, self.shadow, self._fp = active, shadow, fp
+            self.last_error = None
+            self.reloads += 1
+            return True
+
+    def set_documents(self, active: dict, shadow: Optional[List[dict]] = None) -> None:
+        """Install rules directly (no loader); validates like a reload."""
+        a = RuleSet.from_dict(active)
+        s = [RuleSet.from_dict(d) for d in shadow or []]
+        with self._lock:
+            self.active, self.shadow = a, s
+            self._fp = _fingerprint({"active": active, "shadow": shadow or []})
+            self.reloads += 1
+
+
+def file_loader(path: str) -> Callable[[], Optional[dict]]:
+    """Loader reading a JSON document from ``path`` (``None`` while the file is missing)."""
+
+    def _load():
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    return _load
+
+
+# --- feature store --------------------------------------------------------------
+
+
+@dataclass
+class RiskEvent:
+    """Something that happened to ``user_id`` (payment sent, ride requested, ...)."""
+
+    kind: str
+    user_id: Optional[str]
+    amount_cents: int = 0
+    counterparty: Optional[str] = None
+    device: Optional[str] = None
+    ts: Optional[float] = None  # epoch seconds; now when omitted
+
+
+def _event_updates(ev: RiskEvent) -> List[Tuple[str, str, Dict[str, float], Dict[str, str]]]:
+    """(entity type, entity id, counters, distinct values) touched by an event."""
+    counts = {"count": 1.0, "amount": float(ev.amount_cents or 0), f"{ev.kind}_count": 1.0}
+    out = []
+    if ev.user_id:
+        d = {}
+        if ev.counterparty:
+            d["counterparties"] = str(ev.counterparty)
+        if ev.device:
+            d["devices"] = str(ev.device)
+        out.append(("user", str(ev.user_id), counts, d))
+    if ev.device:
+        out.append(("device", str(ev.device), counts, {"users": str(ev.user_id)} if ev.user_id else {}))
+    if ev.counterparty:
+        out.append(("cp", str(ev.counterparty), counts, {"users": str(ev.user_id)} if ev.user_id else {}))
+    return out
+
+
+class FeatureStore:
+    """Rolling per-entity aggregates over named windows.
+
+    Each window is split into up to ``BUCKETS_PER_WINDOW`` buckets of at least a
+    second, so a window slides in steps of ``window / 60`` (10s for ``10m``,
+    24min for ``24h``, 1s for windows up to a minute).
+    """
+
+    def __init__(self, windows: Optional[Mapping[str, int]] = None, clock: Callable[[], float] = time.time):
+        self.windows = dict(windows or DEFAULT_WINDOWS)
+        self.clock = clock
+        self._bucket = {w: max(1, -(-int(secs) // BUCKETS_PER_WINDOW)) for w, secs in self.windows.items()}
+        self._nbuckets = {w: max(1, -(-int(secs) // self._bucket[w])) for w, secs in self.windows.items()}
+
+    def observe(self, event: RiskEvent) -> None:
+        raise NotImplementedError
+
+    def features(self, entities: Mapping[str, Optional[str]], now: Optional[float] = None) -> Dict[str, float]:
+        """``{"user": id, "device": key, "cp": id}`` -> ``{"user.count_1h": ..., ...}``."""
+        raise NotImplementedError
+
+
+class _WindowState:
+    __slots__ = ("buckets", "sums", "distinct")
+
+    def __init__(self) -> None:
+        self.buckets: Deque[list] = deque()  # [idx, {metric: v}, {name: {value: n}}]
+        self.sums: Dict[str, float] = {}
+        self.distinct: Dict[str, Dict[str, int]] = {}
+
+
+def _add(d: dict, key, v) -> None:
+    d[key] = d.get(key, 0) + v
+
+
+class MemoryFeatureStore(FeatureStore):
+    """Per-process store; running sums per window make reads O(1). Bounded by ``max_entities`` (LRU)."""
+
+    def __init__(self, windows: Optional[Mapping[str, int]] = None, *, max_entities: int = 200_000, clock: Callable[[], float] = time.time):
+        super().__init__(windows, clock)
+        self.max_entities = int(max_entities)
+        self._entities: "OrderedDict[Tuple[str, str], Dict[str, _WindowState]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, w: str, st: _WindowState, now: float) -> None:
+        oldest = int(now // self._bucket[w]) - self._nbuckets[w]
+        while st.buckets and st.buckets[0][0] <= oldest:
+            _, counts, distinct = st.buckets.popleft()
+            for m, v in counts.items():
+                left = st.sums[m] - v
+                if left:
+                    st.sums[m] = left
+                else:
+                    del st.sums[m]
+            for name, vals in distinct.items():
+                c = st.distinct[name]
+                for v, n in vals.items():
+                    left = c[v] - n
+                    if left > 0:
+                        c[v] = left
+                    else:
+                        del c[v]
+
+    def observe(self, event: RiskEvent) -> None:
+        now = event.ts if event.ts is not None else self.clock()
+        with self._lock:
+            for etype, eid, counts, distinct in _event_updates(event):
+                key = (etype, eid)
+                state = self._entities.get(key)
+                if state is None:
+                    state = {w: _WindowState() for w in self.windows}
+                    self._entities[key] = state
+                    while len(self._entities) > self.max_entities:
+                        self._entities.popitem(last=False)
+                else:
+                    self._entities.move_to_end(key)
+                for w, st in state.items():
+                    self._expire(w, st, now)
+                    idx = int(now // self._bucket[w])
+                    if not st.buckets or st.buckets[-1][0] != idx:
+                        st.buckets.append([idx, {}, {}])
+                    _, bc, bd = st.buckets[-1]
+                    for m, v in counts.items():
+                        _add(bc, m, v)
+                        _add(st.sums, m, v)
+                    for name, v in distinct.items():
+                        if name not in bd:
+                            bd[name] = {}
+                        if name not in st.distinct:
+                            st.distinct[name] = {}
+                        _add(bd[name], v, 1)
+                        _add(st.distinct[name], v, 1)
+
+    def features(self, entities: Mapping[str, Optional[str]], now: Optional[float] = None) -> Dict[str, float]:
+        now = self.clock() if now is None else now
+        out: Dict[str, float] = {}
+        with self._lock:
+            for etype, eid in entities.items():
+                if not eid:
+                    continue
+                state = self._entities.get((etype, str(eid)))
+                if state is None:
+                    continue
+                for w, st in state.items():
+                    self._expire(w, st, now)
+                    for m, v in st.sums.items():
+                        if v:
+                            out[f"{etype}.{m}_{w}"] = v
+                    for name, c in st.distinct.items():
+                        if c:
+                            out[f"{etype}.{name}_{w}"] = float(len(c))
+        return out
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+
+class RedisFeatureStore(FeatureStore):
+    """Shared store: one hash (+ HyperLogLogs for distinct counts) per entity, window and bucket."""
+
+    def __init__(self, url: str, *, prefix: str = "risk", windows: Optional[Mapping[str, int]] = None, client=None, clock: Callable[[], float] = time.time):
+        super().__init__(windows, clock)
+        self.prefix = prefix
+        self._r = client or get_redis(url)
+
+    def _key(self, etype: str, eid: str, w: str, idx: int) -> str:
+        return f"{self.prefix}:{etype}:{eid}:{w}:{idx}"
+
+    def observe(self, event: RiskEvent) -> None:
+        now = event.ts if event.ts is not None else self.clock()
+        pipe = self._r.pipeline(transaction=False)
+        for etype, eid, counts, distinct in _event_updates(event):
+            for w, secs in self.windows.items():
+                idx = int(now // self._bucket[w])
+                key = self._key(etype, eid, w, idx)
+                ttl = int(secs + self._bucket[w] * 2)
+                for m, v in counts.items():
+                    pipe.hincrbyfloat(key, m, v)
+                pipe.expire(key, ttl)
+                for name, v in distinct.items():
+                    pipe.pfadd(f"{key}:{name}", v)
+                    pipe.expire(f"{key}:{name}", ttl)
+        pipe.execute()
+
+    def features(self, entities: Mapping[str, Optional[str]], now: Optional[float] = None) -> Dict[str, float]:
+        now = self.clock() if now is None else now
+        pipe = self._r.pipeline(transaction=False)
+        plan = []
+        for etype, eid in entities.items():
+            if not eid:
+                continue
+            for w in self.windows:
+                idx = int(now // self._bucket[w])
+                keys = [self._key(etype, str(eid), w, i) for i in range(idx - self._nbuckets[w] + 1, idx + 1)]
+                for k in keys:
+                    pipe.hgetall(k)
+                names = ("counterparties", "devices") if etype == "user" else ("users",)
+                for name in names:
+                    pipe.pfcount(*[f"{k}:{name}" for k in keys])
+                plan.append((etype, w, len(keys), names))
+        res = pipe.execute() if plan else []
+        out: Dict[str, float] = {}
+        pos = 0
+        for etype, w, nkeys, names in plan:
+            sums: Counter = Counter()
+            for h in res[pos:pos + nkeys]:
+                for m, v in (h or {}).items():
+                    sums[m.decode() if isinstance(m, bytes) else m] += float(v)
+            pos += nkeys
+            for m, v in sums.items():
+                if v:
+                    out[f"{etype}.{m}_{w}"] = v
+            for name in names:
+                if res[pos]:
+                    out[f"{etype}.{name}_{w}"] = float(res[pos])
+                pos += 1
+        return out
+
+
+def feature_store_from_env(redis_url: Optional[str] = None, prefix: str = "risk", windows: Optional[Mapping[str, int]] = None) -> FeatureStore:
+    """``RISK_FEATURE_BACKEND`` = memory|redis (default memory); ``RISK_FEATURE_WINDOWS`` = ``10m=600,1h=3600,...``
+    unless ``windows`` is given."""
+    raw = os.getenv("RISK_FEATURE_WINDOWS", "") if windows is None else ""
+    windows = dict(windows or DEFAULT_WINDOWS)
+    if raw.strip():
+        try:
+            windows = {k.strip(): int(v) for k, v in (p.split("=", 1) for p in raw.split(",") if p.strip())}
+        except ValueError:
+            log.warning("invalid RISK_FEATURE_WINDOWS=%r, using defaults", raw)
+    if os.getenv("RISK_FEATURE_BACKEND", "memory").lower() == "redis" and redis_url:
+        return RedisFeatureStore(redis_url, prefix=prefix, windows=windows)
+    return MemoryFeatureStore(windows)
+
+
+# --- request context ------------------------------------------------------------
+
+_device: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("risk_device", default=None)
+
+
+def current_device() -> Optional[str]:
+    return _device.get()
+
+
+def set_current_device(device: Optional[str]):
+    return _device.set(device)
+
+
+class RiskContextMiddleware:
+    """ASGI middleware exposing the caller's device key via ``current_device()``.
+
+    Uses the ``X-Device-ID`` header, else a fingerprint of client IP + user agent.
+    """
+
+    def __init__(self, app, header: str = "x-device-id"):
+        self.app = app
+        self.header = header.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        device = headers.get(self.header)
+        if device:
+            device = device.decode(errors="ignore")[:128]
+        else:
+            ip = (scope.get("client") or ("", 0))[0] or ""
+            ua = headers.get(b"user-agent", b"").decode(errors="ignore")
+            device = "fp:" + hashlib.sha256(f"{ip}|{ua}".encode()).hexdigest()[:32]
+        token = _device.set(device)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _device.reset(token)
+
+
+# --- decisions & engine ------------------------------------------------------------
+
+
+@dataclass
+class Decision:
+    engine: str
+    context: str
+    subject: Optional[str]
+    action: str
+    score: float
+    version: str
+    enforced: bool
+    hits: List[Hit]
+    features: Dict[str, Any]
+    shadow: List[dict] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    amount_cents: int = 0
+    elapsed_ms: float = 0.0
+    ts: float = field(default_factory=time.time)
+
+    @property
+    def blocked(self) -> bool:
+        return self.enforced and self.action == "block"
+
+    @property
+    def flagged(self) -> bool:
+        return self.enforced and self.action == "flag"
+
+    def explain(self) -> dict:
+        return {
+            "engine": self.engine,
+            "context": self.context,
+            "subject": self.subject,
+            "action": self.action,
+            "score": self.score,
+            "version": self.version,
+            "enforced": self.enforced,
+            "amount_cents": self.amount_cents,
+            "hits": [h.to_dict() for h in self.hits],
+            "features": self.features,
+            "shadow": self.shadow,
+            "errors": self.errors,
+            "elapsed_ms": round(self.elapsed_ms, 3),
+            "ts": self.ts,
+        }
+
+
+class DecisionRecorder:
+    """Hands decisions to ``writer(list_of_explanations)`` in batches on a background thread.
+
+    Recording never blocks or fails the caller; when the queue is full decisions are dropped and counted.
+    """
+
+    def __init__(self, writer: Callable[[List[dict]], None], *, batch: int = 200, flush_secs: float = 1.0, maxsize: int = 10_000):
+        self.writer = writer
+        self.batch = int(batch)
+        self.flush_secs = float(flush_secs)
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._q: "queue.Queue[dict]" = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, decision: Decision) -> None:
+        try:
+            self._q.put_nowait(decision.explain())
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._loop, name="risk-recorder", daemon=True)
+                    self._thread.start()
+
+    def _drain(self, first: Optional[dict] = None) -> None:
+        items = [first] if first is not None else []
+        while len(items) < self.batch:
+            try:
+                items.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        if not items:
+            return
+        try:
+            self.writer(items)
+            self.written += len(items)
+        except Exception:
+            self.errors += 1
+            log.warning("risk decision writer failed for %d decisions", len(items), exc_info=True)
+        finally:
+            for _ in items:
+                self._q.task_done()
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                first = self._q.get(timeout=self.flush_secs)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._drain(first)
+
+    def flush(self) -> None:
+        """Write everything recorded so far (tests, shutdown, audit reads)."""
+        with self._lock:
+            while not self._q.empty():
+                self._drain()
+        self._q.join()  # a batch the background thread already took
+
+
+@dataclass
+class EngineStats:
+    decisions: Counter = field(default_factory=Counter)
+    shadow_disagreements: int = 0
+    rule_errors: int = 0
+    observed: int = 0
+    total_ms: float = 0.0
+
+
+_engines: List["RiskEngine"] = []
+_engines_lock = threading.Lock()
+
+
+class RiskEngine:
+    def __init__(
+        self,
+        name: str,
+        registry: RuleRegistry,
+        store: Optional[FeatureStore] = None,
+        *,
+        mode: str = "enforce",
+        recorder: Optional[DecisionRecorder] = None,
+    ):
+        if mode not in ("enforce", "shadow"):
+            raise ValueError("mode must be enforce or shadow")
+        self.name = name
+        self.registry = registry
+        self.store = store or MemoryFeatureStore()
+        self.mode = mode
+        self.recorder = recorder
+        self.stats = EngineStats()
+        with _engines_lock:
+            _engines.append(self)
+
+    def observe(self, event: RiskEvent) -> None:
+        try:
+            self.store.observe(event)
+            self.stats.observed += 1
+        except Exception:
+            log.warning("risk feature update failed", exc_info=True)
+
+    def evaluate(
+        self,
+        context: str,
+        *,
+        user_id: Optional[str],
+        amount_cents: int = 0,
+        counterparty: Optional[str] = None,
+        device: Optional[str] = None,
+        facts: Optional[Mapping[str, Any]] = None,
+        now: Optional[float] = None,
+        record: bool = True,
+    ) -> Decision:
+        t0 = time.perf_counter()
+        active, shadows = self.registry.current()
+        device = device if device is not None else current_device()
+        f = Features()
+        try:
+            f.update(self.store.features({"user": user_id, "device": device, "cp": counterparty}, now=now))
+        except Exception:
+            log.warning("risk feature read failed", exc_info=True)
+        f.update(facts or {})
+        f["amount_cents"] = amount_cents
+        f["context"] = context
+        v = active.evaluate(f)
+        shadow_out = []
+        for s in shadows:
+            sv = s.evaluate(f)
+            shadow_out.append({"version": sv.version, "action": sv.action, "score": sv.score, "hits": [h.rule for h in sv.hits]})
+            if sv.action != v.action:
+                self.stats.shadow_disagreements += 1
+        used = set(active.names).union(*[s.names for s in shadows]) if shadows else active.names
+        d = Decision(
+            engine=self.name,
+            context=context,
+            subject=str(user_id) if user_id else None,
+            action=v.action,
+            score=v.score,
+            version=v.version,
+            enforced=self.mode == "enforce",
+            hits=v.hits,
+            features={n: f[n] for n in sorted(used)},
+            shadow=shadow_out,
+            errors=v.errors,
+            amount_cents=int(amount_cents or 0),
+        )
+        d.elapsed_ms = (time.perf_counter() - t0) * 1000
+        self.stats.decisions[d.action] += 1
+        self.stats.rule_errors += len(v.errors)
+        self.stats.total_ms += d.elapsed_ms
+        if record and self.recorder is not None:
+            self.recorder.record(d)
+        return d
+
+    def snapshot(self) -> dict:
+        active, shadows = self.registry.active, self.registry.shadow
+        n = sum(self.stats.decisions.values())
+        return {
+            "engine": self.name,
+            "mode": self.mode,
+            "active_version": active.version,
+            "shadow_versions": [s.version for s in shadows],
+            "decisions": dict(self.stats.decisions),
+            "shadow_disagreements": self.stats.shadow_disagreements,
+            "rule_errors": self.stats.rule_errors,
+            "observed": self.stats.observed,
+            "avg_ms": round(self.stats.total_ms / n, 4) if n else 0.0,
+            "reloads": self.registry.reloads,
+            "reload_errors": self.registry.reload_errors,
+            "last_reload_error": self.registry.last_error,
+            "recorder": (
+                {"written": self.recorder.written, "dropped": self.recorder.dropped, "errors": self.recorder.errors} if self.recorder else None
+            ),
+        }
+
+
+def risk_stats() -> List[dict]:
+    with _engines_lock:
+        engines = list(_engines)
+    return [e.snapshot() for e in engines]
+
+
+def mode_from_env(default: str = "enforce") -> str:
+    """``RISK_MODE`` = enforce|shadow."""
+    mode = os.getenv("RISK_MODE", default).lower()
+    return mode if mode in ("enforce", "shadow") else default
+
+
+# --- replay ---------------------------------------------------------------------
+
+
+def replay(
+    events: Iterable[Mapping[str, Any]],
+    rulesets: Mapping[str, RuleSet],
+    *,
+    windows: Optional[Mapping[str, int]] = None,
+) -> dict:
+    """Run recorded events (oldest first) through each rule set.
+
+    Every event is evaluated against the features built from the events before it
+    and then folded into a fresh in-memory store, so all candidates see identical
+    histories. Event fields: ``ts``, ``kind``, ``user_id``, ``amount_cents``,
+    ``counterparty``, ``device``, ``context`` and optional ``facts``.
+    """
+    store = MemoryFeatureStore(windows, max_entities=10_000_000)
+    names = list(rulesets)
+    report = {n: {"version": rulesets[n].version, "decisions": 0, "actions": Counter(), "eval_secs": 0.0, "disagreements": 0} for n in names}
+    baseline = names[0] if names else None
+    n_events = 0
+    t_start = time.perf_counter()
+    feature_secs = 0.0
+    for raw in events:
+        ev = RiskEvent(
+            kind=str(raw.get("kind") or "event"),
+            user_id=raw.get("user_id"),
+            amount_cents=int(raw.get("amount_cents") or 0),
+            counterparty=raw.get("counterparty"),
+            device=raw.get("device"),
+            ts=float(raw["ts"]) if raw.get("ts") is not None else None,
+        )
+        t0 = time.perf_counter()
+        f = Features(store.features({"user": ev.user_id, "device": ev.device, "cp": ev.counterparty}, now=ev.ts))
+        f.update(raw.get("facts") or {})
+        f["amount_cents"] = ev.amount_cents
+        f["context"] = raw.get("context") or ev.kind
+        feature_secs += time.perf_counter() - t0
+        base_action = None
+        for n in names:
+            t1 = time.perf_counter()
+            v = rulesets[n].evaluate(f)
+            rep = report[n]
+            rep["eval_secs"] += time.perf_counter() - t1
+            rep["decisions"] += 1
+            rep["actions"][v.action] += 1
+            if n == baseline:
+                base_action = v.action
+            elif v.action != base_action:
+                rep["disagreements"] += 1
+        store.observe(ev)
+        n_events += 1
+    total = time.perf_counter() - t_start
+    for rep in report.values():
+        rep["actions"] = dict(rep["actions"])
+        rep["decisions_per_sec"] = round(rep["decisions"] / rep["eval_secs"], 1) if rep["eval_secs"] else 0.0
+        rep["eval_secs"] = round(rep["eval_secs"], 4)
+    return {
+        "events": n_events,
+        "elapsed_secs": round(total, 4),
+        "feature_secs": round(feature_secs, 4),
+        "events_per_sec": round(n_events / total, 1) if total else 0.0,
+        "baseline": baseline,
+        "rulesets": report,
+    }
+
+
+def register_prometheus_collector(registry=None) -> bool:
+    """Expose ``risk_*`` metrics labelled by engine."""
+    try:
+        from prometheus_client import REGISTRY  # type: ignore
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily  # type: ignore
+    except Exception:
+        return False
+
+    class _RiskCollector:
+        def collect(self):
+            decisions = CounterMetricFamily("risk_decisions", "Risk decisions by action", labels=["engine", "action"])
+            shadow = CounterMetricFamily("risk_shadow_disagreements", "Shadow verdicts differing from the active one", labels=["engine"])
+            errors = CounterMetricFamily("risk_rule_errors", "Rule evaluation errors", labels=["engine"])
+            reload_errors = CounterMetricFamily("risk_reload_errors", "Rejected rule reloads", labels=["engine"])
+            avg = GaugeMetricFamily("risk_decision_avg_ms", "Average decision latency", labels=["engine"])
+            for row in risk_stats():
+                e = row["engine"]
+                for action, n in row["decisions"].items():
+                    decisions.add_metric([e, action], float(n))
+                shadow.add_metric([e], float(row["shadow_disagreements"]))
+                errors.add_metric([e], float(row["rule_errors"]))
+                reload_errors.add_metric([e], float(row["reload_errors"]))
+                avg.add_metric([e], float(row["avg_ms"]))
+            return [decisions, shadow, errors, reload_errors, avg]
+
+    try:
+        (registry or REGISTRY).register(_RiskCollector())
+    except ValueError:
+        return True
+    except Exception:
+        return False
+    return True
+
+
+__all__ = [
+    "ACTIONS",
+    "Decision",
+    "DecisionRecorder",
+    "FeatureStore",
+    "Features",
+    "MemoryFeatureStore",
+    "RedisFeatureStore",
+    "RiskContextMiddleware",
+    "RiskEngine",
+    "RiskEvent",
+    "Rule",
+    "RuleError",
+    "RuleRegistry",
+    "RuleSet",
+    "compile_expr",
+    "current_device",
+    "feature_store_from_env",
+    "file_loader",
+    "mode_from_env",
+    "register_prometheus_collector",
+    "replay",
+    "risk_stats",
+    "set_current_device",
+]
@@ -0,0 +1,1010 @@
+"""
+Lease-based job scheduler for background loops.
+
+Services used to start ``asyncio.create_task`` loops (or expose "call me
+periodically" endpoints). With N workers every loop ran N times concurrently
+and only row locks/idempotency kept the results sane. Here each job runs
+under a lease:
+
+- a job is split into ``partitions``; each partition is a lease
+  (``<job>#<p>``) that at most one scheduler instance holds at a time,
+- every acquisition bumps a monotonically increasing fencing ``token``; work
+  that must not be applied by a stale holder calls ``ctx.check()`` (or
+  compares tokens itself) before committing,
+- instances heartbeat into a membership set and hold at most
+  ``ceil(partitions / live_instances)`` partitions, so work is split rather
+  than raced for; the job function processes only items in its partition
+  (``partition_of`` / ``sql_partition_clause``),
+- the next fire time is stored with the lease, so a fire is executed once
+  across instances, on an ``IntervalTrigger`` or ``CronTrigger`` schedule,
+- runs are recorded (history) and counted (``scheduler_*`` metrics).
+
+Backends: ``SqlLeaseStore`` (Postgres, uses the DB clock), ``RedisLeaseStore``
+(Lua compare-and-set), ``MemoryLeaseStore`` (single process / tests).
+
+Usage::
+
+    from superapp_shared.scheduler import IntervalTrigger, Scheduler, SqlLeaseStore, install_scheduler
+
+    sched = Scheduler(SqlLeaseStore(engine), service="payments")
+    sched.add_job("invoice_autopay", run_autopay, IntervalTrigger(30), partitions=4)
+    install_scheduler(app, sched)
+
+    def run_autopay(ctx):
+        q = q.filter(sql_partition_clause(Invoice.id, ctx))
+        ...
+        ctx.check()  # raises LeaseLost if another instance took over
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .redis_pool import get_redis
+
+
+log = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """The lease (or its fencing token) is no longer held by this instance."""
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# --- triggers ---------------------------------------------------------------
+
+
+class IntervalTrigger:
+    """Fire every ``seconds``; the first fire is immediate unless ``start_delay``."""
+
+    def __init__(self, seconds: float, start_delay: float = 0.0):
+        if seconds <= 0:
+            raise ValueError("interval must be positive")
+        self.seconds = float(seconds)
+        self.start_delay = float(start_delay)
+
+    def first(self, now: datetime) -> datetime:
+        return now + timedelta(seconds=self.start_delay)
+
+    def next_after(self, prev: datetime, now: datetime) -> datetime:
+        nxt = prev + timedelta(seconds=self.seconds)
+        if nxt <= now:
+            # Missed fires are coalesced into one instead of replayed back-to-back
+            nxt = now + timedelta(seconds=self.seconds)
+        return nxt
+
+    def __repr__(self) -> str:
+        return f"IntervalTrigger({self.seconds:g}s)"
+
+
+class CronTrigger:
+    """Five-field cron expression (minute hour day-of-month month day-of-week), UTC.
+
+    Supports ``*``, numbers, ranges ``a-b``, steps ``*/n`` / ``a-b/n`` and
+    comma lists; day-of-week 0-7 with 0 and 7 meaning Sunday. As in cron,
+    when both day fields are restricted a day matches if either does.
+    """
+
+    _RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expr: str):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        self.expr = expr
+        fields = [self._parse(p, lo, hi) for p, (lo, hi) in zip(parts, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, dows = fields
+        self.dows = {d % 7 for d in dows}
+        self._dom_any = parts[2] == "*"
+        self._dow_any = parts[4] == "*"
+
+    @staticmethod
+    def _parse(field_: str, lo: int, hi: int) -> set:
+        out: set = set()
+        for part in field_.split(","):
+            step = 1
+            if "/" in part:
+                part, s = part.split("/", 1)
+                step = int(s)
+                if step <= 0:
+                    raise ValueError("cron step must be positive")
+            if part == "*":
+                a, b = lo, hi
+            elif "-" in part:
+                a, b = (int(x) for x in part.split("-", 1))
+            else:
+                a = int(part)
+                b = hi if step > 1 else a
+            if a < lo or b > hi or a > b:
+                raise ValueError(f"cron value out of range: {field_!r}")
+            out.update(range(a, b + 1, step))
+        return out
+
+    def _day_ok(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = ((dt.weekday() + 1) % 7) in self.dows  # cron: 0=Sunday
+        if self._dom_any and self._dow_any:
+            return True
+        if self._dom_any:
+            return dow
+        if self._dow_any:
+            return dom
+        return dom or dow
+
+    def first(self, now: datetime) -> datetime:
+        return self.next_after(now, now)
+
+    def next_after(self, prev: datetime, now: datetime) -> datetime:
+        dt = max(prev, now).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                # jump to the first day of next month
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_ok(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+                continue
+            if dt.minute not in self.minutes:
+                dt = dt + timedelta(minutes=1)
+                continue
+            return dt
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+    def __repr__(self) -> str:
+        return f"CronTrigger({self.expr!r})"
+
+
+# --- partitions ---------------------------------------------------------------
+
+
+def partition_of(key: Any, partitions: int) -> int:
+    """Stable partition for ``key`` (crc32), identical in every process."""
+    if partitions <= 1:
+        return 0
+    return zlib.crc32(str(key).encode()) % partitions
+
+
+def sql_partition_clause(column, ctx: "JobContext"):
+    """SQLAlchemy filter selecting rows of ``ctx.partition`` (Postgres ``hashtext``)."""
+    from sqlalchemy import String, cast, func, true  # type: ignore
+
+    if ctx.partitions <= 1:
+        return true()
+    return func.mod(func.abs(func.hashtext(cast(column, String))), ctx.partitions) == ctx.partition
+
+
+# --- records ----------------------------------------------------------------
+
+
+@dataclass
+class RunRecord:
+    job: str
+    partition: int
+    owner: str
+    token: int
+    scheduled_for: Optional[datetime]
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    status: str = "running"  # ok|error|lease_lost
+    error: Optional[str] = None
+    result: Optional[str] = None
+
+    def to_json(self) -> dict:
+        d = asdict(self)
+        for k in ("scheduled_for", "started_at", "finished_at"):
+            if d[k] is not None:
+                d[k] = d[k].isoformat()
+        return d
+
+
+# --- stores -----------------------------------------------------------------
+
+
+class LeaseStore:
+    """Backend interface. All times are the backend's own clock where it has one."""
+
+    def acquire(self, key: str, owner: str, ttl: float) -> Optional[int]:
+        """Take (or keep) the lease; returns the fencing token or None."""
+        raise NotImplementedError
+
+    def renew(self, key: str, owner: str, token: int, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def release(self, key: str, owner: str, token: int) -> None:
+        raise NotImplementedError
+
+    def holder(self, key: str) -> Optional[Tuple[str, int]]:
+        """Current ``(owner, token)`` of an unexpired lease."""
+        raise NotImplementedError
+
+    def next_due(self, key: str) -> Optional[datetime]:
+        raise NotImplementedError
+
+    def set_next_due(self, key: str, owner: str, token: int, due: datetime) -> bool:
+        """Store the next fire time, only if ``(owner, token)`` still holds the lease."""
+        raise NotImplementedError
+
+    def heartbeat(self, group: str, instance: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    def members(self, group: str) -> List[str]:
+        raise NotImplementedError
+
+    def leave(self, group: str, instance: str) -> None:
+        raise NotImplementedError
+
+    def record_run(self, run: RunRecord, keep: int = 100) -> None:
+        raise NotImplementedError
+
+    def runs(self, job: str, limit: int = 20) -> List[dict]:
+        raise NotImplementedError
+
+    def now(self) -> datetime:
+        return _utcnow()
+
+
+class MemoryLeaseStore(LeaseStore):
+    """Thread-safe in-process store; instances sharing one object behave like a cluster."""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._leases: Dict[str, Tuple[str, int, float]] = {}
+        self._tokens: Dict[str, int] = {}
+        self._due: Dict[str, datetime] = {}
+        self._members: Dict[str, Dict[str, float]] = {}
+        self._runs: Dict[str, Deque[dict]] = {}
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self._clock(), timezone.utc)
+
+    def _live(self, key: str) -> Optional[Tuple[str, int, float]]:
+        cur = self._leases.get(key)
+        if cur and cur[2] > self._clock():
+            return cur
+        return None
+
+    def acquire(self, key, owner, ttl):
+        with self._lock:
+            cur = self._live(key)
+            if cur and cur[0] != owner:
+                return None
+            if cur:
+                token = cur[1]
+            else:
+                token = self._tokens.get(key, 0) + 1
+                self._tokens[key] = token
+            self._leases[key] = (owner, token, self._clock() + ttl)
+            return token
+
+    def renew(self, key, owner, token, ttl):
+        with self._lock:
+            cur = self._live(key)
+            if not cur or cur[0] != owner or cur[1] != token:
+                return False
+            self._leases[key] = (owner, token, self._clock() + ttl)
+            return True
+
+    def release(self, key, owner, token):
+        with self._lock:
+            cur = self._leases.get(key)
+            if cur and cur[0] == owner and cur[1] == token:
+                del self._leases[key]
+
+    def holder(self, key):
+        with self._lock:
+            cur = self._live(key)
+            return (cur[0], cur[1]) if cur else None
+
+    def next_due(self, key):
+        with self._lock:
+            return self._due.get(key)
+
+    def set_next_due(self, key, owner, token, due):
+        with self._lock:
+            cur = self._live(key)
+            if not cur or cur[0] != owner or cur[1] != token:
+                return False
+            self._due[key] = due
+            return True
+
+    def heartbeat(self, group, instance, ttl):
+        with self._lock:
+            self._members.setdefault(group, {})[instance] = self._clock() + ttl
+
+    def members(self, group):
+        with self._lock:
+            now = self._clock()
+            return sorted(i for i, exp in self._members.get(group, {}).items() if exp > now)
+
+    def leave(self, group, instance):
+        with self._lock:
+            self._members.get(group, {}).pop(instance, None)
+
+    def record_run(self, run, keep=100):
+        with self._lock:
+            q = self._runs.setdefault(run.job, deque(maxlen=keep))
+            q.appendleft(run.to_json())
+
+    def runs(self, job, limit=20):
+        with self._lock:
+            return list(self._runs.get(job, ()))[:limit]
+
+
+_ACQUIRE_LUA = """
+local cur = redis.call('get', KEYS[1])
+if cur then
+  local sep = string.find(cur, '|', 1, true)
+  if string.sub(cur, 1, sep - 1) ~= ARGV[1] then return nil end
+  redis.call('pexpire', KEYS[1], ARGV[2])
+  return tonumber(string.sub(cur, sep + 1))
+end
+local t = redis.call('incr', KEYS[2])
+redis.call('set', KEYS[1], ARGV[1] .. '|' .. t, 'PX', ARGV[2])
+return t
+"""
+
+_RENEW_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+  return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+  return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_SET_DUE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+  redis.call('hset', KEYS[2], ARGV[2], ARGV[3])
+  return 1
+end
+return 0
+"""
+
+
+class RedisLeaseStore(LeaseStore):
+    """Leases as ``SET PX`` keys holding ``owner|token``; tokens from ``INCR``."""
+
+    def __init__(self, url: str, prefix: str = "sched", client=None):
+        self._r = client if client is not None else get_redis(url, decode_responses=True)
+        if self._r is None:
+            raise RuntimeError("redis unavailable for scheduler")
+        self.prefix = prefix
+        self._acquire = self._r.register_script(_ACQUIRE_LUA)
+        self._renew = self._r.register_script(_RENEW_LUA)
+        self._release = self._r.register_script(_RELEASE_LUA)
+        self._set_due = self._r.register_script(_SET_DUE_LUA)
+
+    def _k(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def now(self) -> datetime:
+        secs, micros = self._r.time()
+        return datetime.fromtimestamp(int(secs) + int(micros) / 1e6, timezone.utc)
+
+    def acquire(self, key, owner, ttl):
+        t = self._acquire(keys=[self._k("lease", key), self._k("fence", key)], args=[owner, int(ttl * 1000)])
+        return int(t) if t is not None else None
+
+    def renew(self, key, owner, token, ttl):
+        return bool(self._renew(keys=[self._k("lease", key)], args=[f"{owner}|{token}", int(ttl * 1000)]))
+
+    def release(self, key, owner, token):
+        self._release(keys=[self._k("lease", key)], args=[f"{owner}|{token}"])
+
+    def holder(self, key):
+        v = self._r.get(self._k("lease", key))
+        if not v:
+            return None
+        owner, _, tok = v.rpartition("|")
+        return owner, int(tok)
+
+    def next_due(self, key):
+        v = self._r.hget(self._k("due"), key)
+        return datetime.fromisoformat(v) if v else None
+
+    def set_next_due(self, key, owner, token, due):
+        return bool(
+            self._set_due(keys=[self._k("lease", key), self._k("due")], args=[f"{owner}|{token}", key, due.isoformat()])
+        )
+
+    def heartbeat(self, group, instance, ttl):
+        now = self.now().timestamp()
+        k = self._k("members", group)
+        p = self._r.pipeline()
+        p.zadd(k, {instance: now + ttl})
+        p.zremrangebyscore(k, "-inf", now)
+        p.execute()
+
+    def members(self, group):
+        now = self.now().timestamp()
+        return sorted(self._r.zrangebyscore(self._k("members", group), now, "+inf"))
+
+    def leave(self, group, instance):
+        self._r.zrem(self._k("members", group), instance)
+
+    def record_run(self, run, keep=100):
+        k = self._k("runs", run.job)
+        p = self._r.pipeline()
+        p.lpush(k, json.dumps(run.to_json()))
+        p.ltrim(k, 0, keep - 1)
+        p.execute()
+
+    def runs(self, job, limit=20):
+        return [json.loads(v) for v in self._r.lrange(self._k("runs", job), 0, limit - 1)]
+
+
+class SqlLeaseStore(LeaseStore):
+    """Postgres-backed store (``scheduler_*`` tables); expiry uses the DB clock."""
+
+    def __init__(self, engine, create: bool = True):
+        self.engine = engine
+        self._tables = _sql_tables()
+        if create:
+            self.ensure_schema()
+
+    def ensure_schema(self) -> None:
+        self._tables["metadata"].create_all(self.engine, checkfirst=True)
+
+    def _exec(self, sql: str, **params):
+        from sqlalchemy import text  # type: ignore
+
+        with self.engine.begin() as conn:
+            return conn.execute(text(sql), params).fetchall()
+
+    def now(self) -> datetime:
+        return self._exec("SELECT clock_timestamp()")[0][0]
+
+    def acquire(self, key, owner, ttl):
+        rows = self._exec(
+            """
+            INSERT INTO scheduler_leases (name, owner, token, expires_at)
+            VALUES (:k, :o, 1, clock_timestamp() + make_interval(secs => :ttl))
+            ON CONFLICT (name) DO UPDATE SET
+                token = CASE WHEN scheduler_leases.owner = :o AND scheduler_leases.expires_at > clock_timestamp()
+                             THEN scheduler_leases.token ELSE scheduler_leases.token + 1 END,
+                owner = :o,
+                expires_at = clock_timestamp() + make_interval(secs => :ttl)
+            WHERE scheduler_leases.expires_at <= clock_timestamp() OR scheduler_leases.owner = :o
+            RETURNING token
+            """,
+            k=key, o=owner, ttl=float(ttl),
+        )
+        return int(rows[0][0]) if rows else None
+
+    def renew(self, key, owner, token, ttl):
+        rows = self._exec(
+            """
+            UPDATE scheduler_leases SET expires_at = clock_timestamp() + make_interval(secs => :ttl)
+            WHERE name = :k AND owner = :o AND token = :t AND expires_at > clock_timestamp()
+            RETURNING token
+            """,
+            k=key, o=owner, t=int(token), ttl=float(ttl),
+        )
+        return bool(rows)
+
+    def release(self, key, owner, token):
+        # Keep the row: the token counter must stay monotonic
+        self._exec(
+            "UPDATE scheduler_leases SET expires_at = clock_timestamp() WHERE name = :k AND owner = :o AND token = :t RETURNING token",
+            k=key, o=owner, t=int(token),
+        )
+
+    def holder(self, key):
+        rows = self._exec(
+            "SELECT owner, token FROM scheduler_leases WHERE name = :k AND expires_at > clock_timestamp()", k=key
+        )
+        return (rows[0][0], int(rows[0][1])) if rows else None
+
+    def next_due(self, key):
+        rows = self._exec("SELECT next_due FROM scheduler_leases WHERE name = :k", k=key)
+        return rows[0][0] if rows else None
+
+    def set_next_due(self, key, owner, token, due):
+        rows = self._exec(
+            """
+            UPDATE scheduler_leases SET next_due = :d
+            WHERE name = :k AND owner = :o AND token = :t AND expires_at > clock_timestamp()
+            RETURNING token
+            """,
+            k=key, o=owner, t=int(token), d=due,
+        )
+        return bool(rows)
+
+    def heartbeat(self, group, instance, ttl):
+        self._exec(
+            """
+            INSERT INTO scheduler_members (grp, instance, expires_at)
+            VALUES (:g, :i, clock_timestamp() + make_interval(secs => :ttl))
+            ON CONFLICT (grp, instance) DO UPDATE SET expires_at = excluded.expires_at
+            RETURNING instance
+            """,
+            g=group, i=instance, ttl=float(ttl),
+        )
+
+    def members(self, group):
+        rows = self._exec(
+            "SELECT instance FROM scheduler_members WHERE grp = :g AND expires_at > clock_timestamp() ORDER BY instance",
+            g=group,
+        )
+        return [r[0] for r in rows]
+
+    def leave(self, group, instance):
+        self._exec("DELETE FROM scheduler_members WHERE grp = :g AND instance = :i RETURNING instance", g=group, i=instance)
+
+    def record_run(self, run, keep=100):
+        self._exec(
+            """
+            INSERT INTO scheduler_runs (job, partition, owner, token, scheduled_for, started_at, finished_at, status, error, result)
+            VALUES (:job, :partition, :owner, :token, :scheduled_for, :started_at, :finished_at, :status, :error, :result)
+            RETURNING id
+            """,
+            **{**asdict(run), "error": (run.error or None) and run.error[:512], "result": (run.result or None) and run.result[:1024]},
+        )
+        self._exec(
+            """
+            DELETE FROM scheduler_runs WHERE job = :j AND id <= (
+                SELECT id FROM scheduler_runs WHERE job = :j ORDER BY id DESC OFFSET :n LIMIT 1
+            ) RETURNING id
+            """,
+            j=run.job, n=int(keep),
+        )
+
+    def runs(self, job, limit=20):
+        rows = self._exec(
+            """
+            SELECT job, partition, owner, token, scheduled_for, started_at, finished_at, status, error, result
+            FROM scheduler_runs WHERE job = :j ORDER BY id DESC LIMIT :n
+            """,
+            j=job, n=int(limit),
+        )
+        keys = ("job", "partition", "owner", "token", "scheduled_for", "started_at", "finished_at", "status", "error", "result")
+        out = []
+        for r in rows:
+            d = dict(zip(keys, r))
+            for k in ("scheduled_for", "started_at", "finished_at"):
+                if d[k] is not None:
+                    d[k] = d[k].isoformat()
+            out.append(d)
+        return out
+
+
+_SQL_TABLES: Optional[dict] = None
+
+
+def _sql_tables() -> dict:
+    global _SQL_TABLES
+    if _SQL_TABLES is None:
+        from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, MetaData, String, Table  # type: ignore
+
+        md = MetaData()
+        _SQL_TABLES = {
+            "metadata": md,
+            "leases": Table(
+                "scheduler_leases", md,
+                Column("name", String(128), primary_key=True),
+                Column("owner", String(128), nullable=False),
+                Column("token", BigInteger, nullable=False),
+                Column("expires_at", DateTime(timezone=True), nullable=False),
+                Column("next_due", DateTime(timezone=True), nullable=True),
+            ),
+            "members": Table(
+                "scheduler_members", md,
+                Column("grp", String(64), primary_key=True),
+                Column("instance", String(128), primary_key=True),
+                Column("expires_at", DateTime(timezone=True), nullable=False),
+            ),
+            "runs": Table(
+                "scheduler_runs", md,
+                Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+                Column("job", String(128), nullable=False),
+                Column("partition", Integer, nullable=False),
+                Column("owner", String(128), nullable=False),
+                Column("token", BigInteger, nullable=False),
+                Column("scheduled_for", DateTime(timezone=True), nullable=True),
+                Column("started_at", DateTime(timezone=True), nullable=False),
+                Column("finished_at", DateTime(timezone=True), nullable=True),
+                Column("status", String(16), nullable=False),
+                Column("error", String(512), nullable=True),
+                Column("result", String(1024), nullable=True),
+                Index("ix_scheduler_runs_job_id", "job", "id"),
+            ),
+        }
+    return _SQL_TABLES
+
+
+# --- scheduler --------------------------------------------------------------
+
+
+@dataclass
+class JobContext:
+    job: str
+    partition: int
+    partitions: int
+    token: int
+    owner: str
+    scheduled_for: Optional[datetime]
+    store: LeaseStore = field(repr=False)
+    key: str = ""
+
+    def check(self) -> None:
+        """Raise ``LeaseLost`` unless this run's lease and token are still current."""
+        if self.store.holder(self.key) != (self.owner, self.token):
+            raise LeaseLost(f"{self.key} token {self.token}")
+
+    def owns(self, key: Any) -> bool:
+        return partition_of(key, self.partitions) == self.partition
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[JobContext], Any]
+    trigger: Any
+    partitions: int = 1
+    lease_secs: float = 30.0
+    enabled: bool = True
+
+
+@dataclass
+class _Held:
+    token: int
+    running: Optional[Future] = None
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    errors: int = 0
+    lease_lost: int = 0
+    acquired: int = 0
+    released: int = 0
+    last_duration: float = 0.0
+    last_finished: Optional[float] = None
+
+
+_schedulers: "List[Scheduler]" = []
+_schedulers_lock = threading.Lock()
+
+
+class Scheduler:
+    def __init__(
+        self,
+        store: LeaseStore,
+        *,
+        service: str = "default",
+        instance_id: Optional[str] = None,
+        tick_secs: float = 1.0,
+        max_workers: int = 4,
+        member_ttl: Optional[float] = None,
+        history: int = 100,
+        synchronous: bool = False,
+    ):
+        self.store = store
+        self.service = service
+        self.instance_id = instance_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.tick_secs = float(tick_secs)
+        self.member_ttl = float(member_ttl or max(5.0, tick_secs * 5))
+        self.keep_history = int(history)
+        # synchronous: jobs run inside tick() (tests, one-shot CLI runs)
+        self.synchronous = synchronous
+        self.jobs: Dict[str, Job] = {}
+        self.stats: Dict[str, JobStats] = {}
+        self._held: Dict[str, _Held] = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool = None if synchronous else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"sched-{service}")
+        with _schedulers_lock:
+            _schedulers.append(self)
+
+    def add_job(
+        self,
+        name: str,
+        func: Callable[[JobContext], Any],
+        trigger,
+        *,
+        partitions: int = 1,
+        lease_secs: float = 30.0,
+        enabled: bool = True,
+    ) -> Job:
+        job = Job(name, func, trigger, max(1, int(partitions)), float(lease_secs), enabled)
+        self.jobs[name] = job
+        self.stats.setdefault(name, JobStats())
+        return job
+
+    def _key(self, job: Job, p: int) -> str:
+        return f"{self.service}:{job.name}#{p}"
+
+    # -- lifecycle --------------------------------------------------------
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"scheduler-{self.service}", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        self._stop.set()
+        if self._thread is not None and wait:
+            self._thread.join(self.tick_secs * 2 + 1)
+        self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+        self.release_all()
+        try:
+            self.store.leave(self.service, self.instance_id)
+        except Exception:
+            pass
+
+    def release_all(self) -> None:
+        with self._lock:
+            held = list(self._held.items())
+            self._held.clear()
+        for key, h in held:
+            try:
+                self.store.release(key, self.instance_id, h.token)
+            except Exception:
+                pass
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                log.exception("scheduler tick failed")
+            self._stop.wait(self.tick_secs)
+
+    # -- one pass ---------------------------------------------------------
+
+    def tick(self) -> int:
+        """Heartbeat, rebalance, renew/claim leases and start due runs. Returns runs started."""
+        self.store.heartbeat(self.service, self.instance_id, self.member_ttl)
+        live = max(1, len(self.store.members(self.service)))
+        now = self.store.now()
+        started = 0
+        for job in list(self.jobs.values()):
+            if not job.enabled:
+                continue
+            quota = math.ceil(job.partitions / live)
+            # Start from a per-instance offset so instances prefer different partitions
+            offset = partition_of(self.instance_id, job.partitions)
+            order = [(offset + i) % job.partitions for i in range(job.partitions)]
+            mine = [p for p in order if self._key(job, p) in self._held]
+            # Give back surplus partitions (idle ones first) when instances join
+            for p in mine[quota:]:
+                key = self._key(job, p)
+                h = self._held.get(key)
+                if h and (h.running is None or h.running.done()):
+                    self._release(job, key, h)
+            for p in order:
+                key = self._key(job, p)
+                h = self._held.get(key)
+                if h is not None:
+                    if not self.store.renew(key, self.instance_id, h.token, job.lease_secs):
+                        self._lost(job, key)
+                        continue
+                else:
+                    if sum(1 for q in order if self._key(job, q) in self._held) >= quota:
+                        continue
+                    token = self.store.acquire(key, self.instance_id, job.lease_secs)
+                    if token is None:
+                        continue
+                    h = self._held[key] = _Held(token)
+                    self.stats[job.name].acquired += 1
+                if h.running is not None and not h.running.done():
+                    continue
+                if self._maybe_run(job, p, key, h, now):
+                    started += 1
+        return started
+
+    def _release(self, job: Job, key: str, h: _Held) -> None:
+        with self._lock:
+            self._held.pop(key, None)
+        try:
+            self.store.release(key, self.instance_id, h.token)
+        except Exception:
+            pass
+        self.stats[job.name].released += 1
+
+    def _lost(self, job: Job, key: str) -> None:
+        with self._lock:
+            self._held.pop(key, None)
+        self.stats[job.name].lease_lost += 1
+        log.warning("scheduler lease lost: %s", key)
+
+    def _maybe_run(self, job: Job, p: int, key: str, h: _Held, now: datetime) -> bool:
+        due = self.store.next_due(key)
+        if due is None:
+            due = job.trigger.first(now)
+            if not self.store.set_next_due(key, self.instance_id, h.token, due):
+                self._lost(job, key)
+                return False
+        if due > now:
+            return False
+        # Claim this fire before running: other instances taking the lease later see the next fire time
+        if not self.store.set_next_due(key, self.instance_id, h.token, job.trigger.next_after(due, now)):
+            self._lost(job, key)
+            return False
+        ctx = JobContext(job.name, p, job.partitions, h.token, self.instance_id, due, self.store, key)
+        if self.synchronous:
+            self._run(job, ctx)
+        else:
+            h.running = self._pool.submit(self._run, job, ctx)
+        return True
+
+    def _run(self, job: Job, ctx: JobContext) -> RunRecord:
+        rec = RunRecord(f"{self.service}:{job.name}", ctx.partition, ctx.owner, ctx.token, ctx.scheduled_for, _utcnow())
+        t0 = time.perf_counter()
+        st = self.stats[job.name]
+        try:
+            result = job.func(ctx)
+            rec.status = "ok"
+            if result is not None:
+                rec.result = json.dumps(result, default=str)[:1024]
+        except LeaseLost as e:
+            rec.status = "lease_lost"
+            rec.error = str(e)
+            st.lease_lost += 1
+        except Exception as e:
+            rec.status = "error"
+            rec.error = f"{type(e).__name__}: {e}"[:512]
+            st.errors += 1
+            log.exception("scheduled job %s#%s failed", job.name, ctx.partition)
+        rec.finished_at = _utcnow()
+        st.runs += 1
+        st.last_duration = time.perf_counter() - t0
+        st.last_finished = time.time()
+        try:
+            self.store.record_run(rec, keep=self.keep_history)
+        except Exception:
+            log.warning("scheduler run history write failed", exc_info=True)
+        return rec
+
+    def run_now(self, name: str, partition: int = 0) -> RunRecord:
+        """Run one partition of a job immediately under its lease (admin/ops)."""
+        job = self.jobs[name]
+        key = self._key(job, partition)
+        h = self._held.get(key)
+        token = h.token if h else self.store.acquire(key, self.instance_id, job.lease_secs)
+        if token is None:
+            raise LeaseLost(f"{key} held by another instance")
+        try:
+            ctx = JobContext(job.name, partition, job.partitions, token, self.instance_id, None, self.store, key)
+            return self._run(job, ctx)
+        finally:
+            if h is None:
+                self.store.release(key, self.instance_id, token)
+
+    # -- introspection ----------------------------------------------------
+
+    def history(self, name: str, limit: int = 20) -> List[dict]:
+        """Recent runs of ``name`` across all instances of this service, newest first."""
+        return self.store.runs(f"{self.service}:{name}", limit)
+
+    def held_partitions(self, name: str) -> List[int]:
+        job = self.jobs[name]
+        return sorted(p for p in range(job.partitions) if self._key(job, p) in self._held)
+
+    def snapshot(self) -> List[dict]:
+        out = []
+        for name, job in self.jobs.items():
+            st = self.stats[name]
+            out.append({
+                "service": self.service,
+                "job": name,
+                "trigger": repr(job.trigger),
+                "partitions": job.partitions,
+                "held": self.held_partitions(name),
+                **asdict(st),
+            })
+        return out
+
+
+def scheduler_stats() -> List[dict]:
+    with _schedulers_lock:
+        scheds = list(_schedulers)
+    return [row for s in scheds for row in s.snapshot()]
+
+
+def store_from_env(engine=None, redis_url: Optional[str] = None, prefix: str = "sched") -> LeaseStore:
+    """``SCHEDULER_BACKEND`` = db|redis|memory (default: db when an engine is given)."""
+    backend = (os.getenv("SCHEDULER_BACKEND", "") or ("db" if engine is not None else "redis")).lower()
+    if backend == "db" and engine is not None:
+        return SqlLeaseStore(engine)
+    if backend == "redis" and redis_url:
+        return RedisLeaseStore(redis_url, prefix=prefix)
+    return MemoryLeaseStore()
+
+
+def install_scheduler(app, scheduler: Scheduler) -> None:
+    """Start the scheduler on app startup and release its leases on shutdown."""
+
+    async def _startup():
+        scheduler.start()
+
+    async def _shutdown():
+        scheduler.stop(wait=False)
+
+    app.add_event_handler("startup", _startup)
+    app.add_event_handler("shutdown", _shutdown)
+    register_prometheus_collector()
+
+
+def register_prometheus_collector(registry=None) -> bool:
+    """Expose ``scheduler_*`` metrics labelled by service and job."""
+    try:
+        from prometheus_client import REGISTRY  # type: ignore
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily  # type: ignore
+    except Exception:
+        return False
+
+    class _SchedulerCollector:
+        def collect(self):
+            labels = ["service", "job"]
+            held = GaugeMetricFamily("scheduler_partitions_held", "Partitions leased by this instance", labels=labels)
+            dur = GaugeMetricFamily("scheduler_last_run_seconds", "Duration of the last run", labels=labels)
+            counters = {
+                name: CounterMetricFamily(f"scheduler_{name}", f"Scheduler {name.replace('_', ' ')}", labels=labels)
+                for name in ("runs", "errors", "lease_lost", "acquired", "released")
+            }
+            for row in scheduler_stats():
+                lv = [row["service"], row["job"]]
+                held.add_metric(lv, float(len(row["held"])))
+                dur.add_metric(lv, float(row["last_duration"]))
+                for name, fam in counters.items():
+                    fam.add_metric(lv, float(row[name]))
+            return [held, dur, *counters.values()]
+
+    try:
+        (registry or REGISTRY).register(_SchedulerCollector())
+    except ValueError:
+        return True
+    except Exception:
+        return False
+    return True
+
+
+__all__ = [
+    "CronTrigger",
+    "IntervalTrigger",
+    "JobContext",
+    "LeaseLost",
+    "LeaseStore",
+    "MemoryLeaseStore",
+    "RedisLeaseStore",
+    "RunRecord",
+    "Scheduler",
+    "SqlLeaseStore",
+    "install_scheduler",
+    "partition_of",
+    "register_prometheus_collector",
+    "scheduler_stats",
+    "sql_partition_clause",
+    "store_from_env",
+]
@@ -0,0 +1,672 @@
+"""
+Inbound webhooks: raw-body verification, replay window, dedupe and durable dispatch.
+
+Service receivers used to parse the request into a dict, ``json.dumps`` it
+again and check the signature against that, so any sender whose key order or
+whitespace differed from Python's compact output was rejected, and the
+handlers ran inline with the sender waiting. ``WebhookInbox`` sits in front of
+the handlers instead:
+
+- the signature is HMAC-SHA256 over ``ts + event`` plus the *raw* request
+  bytes (the Payments signing scheme), checked against every configured secret
+  so a key can be rotated without dropping deliveries (``parse_secrets`` reads
+  ``"current,previous"``),
+- ``ts`` must be within ``tolerance_secs`` of now (replay window),
+- the event is recorded once under its event id (``X-Delivery-ID``, stable
+  across the sender's retries; else the payload ``id``; else a digest of the
+  signed message) and duplicates are acknowledged without running anything,
+- the receiver answers 200 as soon as the event is stored; the handler runs
+  afterwards (FastAPI background task) and, if it raises, is retried with
+  exponential backoff by ``process_due`` (a scheduler job). After
+  ``max_attempts`` the event is marked ``dead`` and copied to the dead-letter
+  table, from where ``requeue_dead`` puts it back.
+
+Handlers get an ``InboundEvent`` and must be idempotent: an event whose
+worker died mid-handler is picked up again once its lease expires.
+
+Stores: ``SqlInboxStore`` (``webhook_inbox`` + ``webhook_dead_letters``,
+claims with ``FOR UPDATE SKIP LOCKED`` so replicas share the retry work) and
+``MemoryInboxStore``; ``webhook_inbox_store_from_env`` picks one
+(``WEBHOOK_INBOX_BACKEND``).
+
+Usage::
+
+    from superapp_shared.webhook_inbox import WebhookInbox, parse_secrets, webhook_inbox_store_from_env
+
+    inbox = WebhookInbox(
+        "carrental", webhook_inbox_store_from_env(engine),
+        secrets=lambda: parse_secrets(settings.PAYMENTS_WEBHOOK_SECRET),
+    )
+
+    @inbox.on("requests.accept", "requests.accepted")
+    def _accepted(ev):
+        with SessionLocal() as db:
+            ...
+            db.commit()
+
+    @router.post("/webhooks")
+    async def receive_webhook(request: Request, background: BackgroundTasks):
+        return await inbox.receive_request(request, background)
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Union
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+DEAD = "dead"
+
+Handler = Callable[["InboundEvent"], Any]
+Secrets = Union[str, Sequence[str], Callable[[], Sequence[str]]]
+
+
+class WebhookVerificationError(Exception):
+    """The request is not an authentic, fresh webhook; ``reason`` says why."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclass
+class InboundEvent:
+    event_id: str
+    event: str
+    payload: Dict[str, Any]
+    attempts: int = 0
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        d = self.payload.get("data")
+        return d if isinstance(d, dict) else {}
+
+
+@dataclass
+class InboxRecord:
+    event_id: str
+    event: str
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+
+
+@dataclass
+class Receipt:
+    event_id: str
+    duplicate: bool
+
+
+# --- signing ----------------------------------------------------------------------
+
+
+def parse_secrets(value: Optional[str]) -> List[str]:
+    """``"current,previous"`` -> ``["current", "previous"]`` (blank entries dropped)."""
+    return [s.strip() for s in (value or "").split(",") if s.strip()]
+
+
+def sign_webhook(secret: str, ts: str, event: str, body: bytes) -> str:
+    return hmac.new(secret.encode("utf-8"), (ts + event).encode("utf-8") + body, hashlib.sha256).hexdigest()
+
+
+def verify_webhook(
+    body: bytes,
+    ts: Optional[str],
+    event: Optional[str],
+    sign: Optional[str],
+    secrets: Sequence[str],
+    tolerance_secs: float = 300,
+    now: Optional[float] = None,
+) -> None:
+    """Raise ``WebhookVerificationError`` unless ``sign`` matches the raw body under one of ``secrets`` and ``ts`` is fresh."""
+    if not ts or not event or not sign:
+        raise WebhookVerificationError("missing_headers")
+    if not secrets:
+        raise WebhookVerificationError("no_secret")
+    try:
+        sent = int(ts)
+    except ValueError:
+        raise WebhookVerificationError("bad_timestamp")
+    # Compare against every secret so timing does not reveal which one matched
+    ok = False
+    for secret in secrets:
+        ok |= hmac.compare_digest(sign_webhook(secret, ts, event, body), sign)
+    if not ok:
+        raise WebhookVerificationError("bad_signature")
+    if tolerance_secs and abs((time.time() if now is None else now) - sent) > tolerance_secs:
+        raise WebhookVerificationError("stale")
+
+
+def event_id_for(headers: Mapping[str, str], ts: str, event: str, body: bytes, payload: Mapping[str, Any]) -> str:
+    """Sender's delivery id, else the payload ``id``, else a digest of the signed message (so exact replays collide)."""
+    delivery = (headers.get("x-delivery-id") or "").strip()
+    if delivery:
+        return delivery[:128]
+    pid = payload.get("id")
+    if isinstance(pid, (str, int)) and str(pid):
+        return f"{event}:{pid}"[:128]
+    return "sha256:" + hashlib.sha256((ts + event).encode("utf-8") + body).hexdigest()
+
+
+# --- stores -----------------------------------------------------------------------
+
+
+class InboxStore:
+    """Event log keyed by (service, event_id). ``claim`` leases due events and counts the attempt."""
+
+    def add(self, service: str, event_id: str, event: str, body: str) -> bool:
+        """Record a new event as due now; False if the id was already recorded."""
+        raise NotImplementedError
+
+    def claim(self, service: str, limit: int, lease_secs: float, event_id: Optional[str] = None) -> List[InboundEvent]:
+        raise NotImplementedError
+
+    def done(self, service: str, event_id: str) -> None:
+        raise NotImplementedError
+
+    def retry(self, service: str, event_id: str, delay_secs: float, error: str) -> None:
+        raise NotImplementedError
+
+    def dead(self, service: str, event_id: str, error: str) -> None:
+        raise NotImplementedError
+
+    def requeue_dead(self, service: str, event_ids: Optional[Sequence[str]] = None) -> int:
+        raise NotImplementedError
+
+    def get(self, service: str, event_id: str) -> Optional[InboxRecord]:
+        raise NotImplementedError
+
+    def dead_letters(self, service: str, limit: int = 100) -> List[InboxRecord]:
+        raise NotImplementedError
+
+    def gc(self, older_than_secs: float, limit: int = 10_000) -> int:
+        """Delete handled events older than ``older_than_secs`` (dead ones are kept)."""
+        raise NotImplementedError
+
+
+def _event(event_id: str, event: str, body: str, attempts: int) -> InboundEvent:
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = {}
+    return InboundEvent(event_id, event, payload if isinstance(payload, dict) else {}, int(attempts))
+
+
+class MemoryInboxStore(InboxStore):
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._rows: Dict[tuple, dict] = {}
+        self._dead: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, service, event_id, event, body):
+        with self._lock:
+            if (service, event_id) in self._rows:
+                return False
+            now = self._clock()
+            self._rows[(service, event_id)] = {
+                "event": event, "body": body, "status": PENDING, "attempts": 0, "due": now,
+                "locked_until": None, "last_error": None, "processed_at": None,
+            }
+            return True
+
+    def claim(self, service, limit, lease_secs, event_id=None):
+        out = []
+        with self._lock:
+            now = self._clock()
+            for (svc, eid), r in sorted(self._rows.items(), key=lambda kv: kv[1]["due"]):
+                if len(out) >= limit:
+                    break
+                if svc != service or (event_id is not None and eid != event_id):
+                    continue
+                if (r["status"] == PENDING and r["due"] <= now) or (r["status"] == PROCESSING and r["locked_until"] <= now):
+                    r.update(status=PROCESSING, attempts=r["attempts"] + 1, locked_until=now + lease_secs)
+                    out.append(_event(eid, r["event"], r["body"], r["attempts"]))
+        return out
+
+    def done(self, service, event_id):
+        with self._lock:
+            r = self._rows.get((service, event_id))
+            if r is not None:
+                r.update(status=DONE, locked_until=None, last_error=None, processed_at=self._clock())
+
+    def retry(self, service, event_id, delay_secs, error):
+        with self._lock:
+            r = self._rows.get((service, event_id))
+            if r is not None:
+                r.update(status=PENDING, locked_until=None, last_error=error, due=self._clock() + delay_secs)
+
+    def dead(self, service, event_id, error):
+        with self._lock:
+            r = self._rows.get((service, event_id))
+            if r is not None:
+                r.update(status=DEAD, locked_until=None, last_error=error, processed_at=self._clock())
+                self._dead[(service, event_id)] = dict(r)
+
+    def requeue_dead(self, service, event_ids=None):
+        n = 0
+        with self._lock:
+            for key in list(self._dead):
+                if key[0] != service or (event_ids is not None and key[1] not in event_ids):
+                    continue
+                del self._dead[key]
+                self._rows[key].update(status=PENDING, attempts=0, last_error=None, due=self._clock())
+                n += 1
+        return n
+
+    def get(self, service, event_id):
+        with self._lock:
+            r = self._rows.get((service, event_id))
+            return InboxRecord(event_id, r["event"], r["status"], r["attempts"], r["last_error"]) if r else None
+
+    def dead_letters(self, service, limit=100):
+        with self._lock:
+            return [
+                InboxRecord(eid, r["event"], DEAD, r["attempts"], r["last_error"])
+                for (svc, eid), r in self._dead.items() if svc == service
+            ][:limit]
+
+    def gc(self, older_than_secs, limit=10_000):
+        with self._lock:
+            cutoff = self._clock() - older_than_secs
+            old = [k for k, r in self._rows.items() if r["status"] == DONE and r["processed_at"] <= cutoff][:limit]
+            for k in old:
+                del self._rows[k]
+            return len(old)
+
+
+_SQL_TABLES: Optional[dict] = None
+
+
+def _sql_tables() -> dict:
+    global _SQL_TABLES
+    if _SQL_TABLES is None:
+        from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text  # type: ignore
+
+        md = MetaData()
+        _SQL_TABLES = {
+            "metadata": md,
+            "inbox": Table(
+                "webhook_inbox", md,
+                Column("service", String(64), primary_key=True),
+                Column("event_id", String(128), primary_key=True),
+                Column("event", String(128), nullable=False),
+                Column("body", Text, nullable=False),
+                Column("status", String(16), nullable=False),
+                Column("attempts", Integer, nullable=False, server_default="0"),
+                Column("next_attempt_at", DateTime(timezone=True), nullable=False),
+                Column("locked_until", DateTime(timezone=True), nullable=True),
+                Column("last_error", Text, nullable=True),
+                Column("received_at", DateTime(timezone=True), nullable=False),
+                Column("processed_at", DateTime(timezone=True), nullable=True),
+                Index("ix_webhook_inbox_due", "service", "status", "next_attempt_at"),
+            ),
+            "dead": Table(
+                "webhook_dead_letters", md,
+                Column("service", String(64), primary_key=True),
+                Column("event_id", String(128), primary_key=True),
+                Column("event", String(128), nullable=False),
+                Column("body", Text, nullable=False),
+                Column("attempts", Integer, nullable=False),
+                Column("last_error", Text, nullable=True),
+                Column("failed_at", DateTime(timezone=True), nullable=False),
+            ),
+        }
+    return _SQL_TABLES
+
+
+class SqlInboxStore(InboxStore):
+    """Postgres-backed store (``webhook_inbox``, ``webhook_dead_letters``); times use the DB clock.
+
+    The tables are created on first use (``create=False`` when migrations own them).
+    """
+
+    def __init__(self, engine, create: bool = True):
+        self.engine = engine
+        self._tables = _sql_tables()
+        self._ready = not create
+        self._schema_lock = threading.Lock()
+
+    def ensure_schema(self) -> None:
+        with self._schema_lock:
+            self._tables["metadata"].create_all(self.engine, checkfirst=True)
+            self._ready = True
+
+    def _exec(self, sql: str, **params):
+        from sqlalchemy import text  # type: ignore
+
+        if not self._ready:
+            self.ensure_schema()
+        with self.engine.begin() as conn:
+            res = conn.execute(text(sql), params)
+            return res.fetchall() if res.returns_rows else res.rowcount
+
+    def add(self, service, event_id, event, body):
+        rows = self._exec(
+            """
+            INSERT INTO webhook_inbox (service, event_id, event, body, status, attempts, next_attempt_at, received_at)
+            VALUES (:s, :e, :ev, :b, 'pending', 0, clock_timestamp(), clock_timestamp())
+            ON CONFLICT (service, event_id) DO NOTHING
+            RETURNING event_id
+            """,
+            s=service, e=event_id, ev=event, b=body,
+        )
+        return bool(rows)
+
+    def claim(self, service, limit, lease_secs, event_id=None):
+        only = "AND event_id = :e" if event_id is not None else ""
+        rows = self._exec(
+            f"""
+            UPDATE webhook_inbox
+               SET status = 'processing', attempts = attempts + 1,
+                   locked_until = clock_timestamp() + make_interval(secs => :lease)
+             WHERE (service, event_id) IN (
+                SELECT service, event_id FROM webhook_inbox
+                 WHERE service = :s {only}
+                   AND ((status = 'pending' AND next_attempt_at <= clock_timestamp())
+                        OR (status = 'processing' AND locked_until <= clock_timestamp()))
+                 ORDER BY next_attempt_at
+                 LIMIT :n
+                 FOR UPDATE SKIP LOCKED
+             )
+            RETURNING event_id, event, body, attempts
+            """,
+            s=service, e=event_id, n=int(limit), lease=float(lease_secs),
+        )
+        return [_event(*r) for r in rows]
+
+    def done(self, service, event_id):
+        self._exec(
+            """
+            UPDATE webhook_inbox SET status = 'done', locked_until = NULL, last_error = NULL, processed_at = clock_timestamp()
+             WHERE service = :s AND event_id = :e
+            """,
+            s=service, e=event_id,
+        )
+
+    def retry(self, service, event_id, delay_secs, error):
+        self._exec(
+            """
+            UPDATE webhook_inbox
+               SET status = 'pending', locked_until = NULL, last_error = :err,
+                   next_attempt_at = clock_timestamp() + make_interval(secs => :d)
+             WHERE service = :s AND event_id = :e
+            """,
+            s=service, e=event_id, d=float(delay_secs), err=error,
+        )
+
+    def dead(self, service, event_id, error):
+        self._exec(
+            """
+            WITH d AS (
+                UPDATE webhook_inbox
+                   SET status = 'dead', locked_until = NULL, last_error = :err, processed_at = clock_timestamp()
+                 WHERE service = :s AND event_id = :e
+                RETURNING service, event_id, event, body, attempts, last_error
+            )
+            INSERT INTO webhook_dead_letters (service, event_id, event, body, attempts, last_error, failed_at)
+            SELECT service, event_id, event, body, attempts, last_error, clock_timestamp() FROM d
+            ON CONFLICT (service, event_id) DO UPDATE SET
+                attempts = EXCLUDED.attempts, last_error = EXCLUDED.last_error, failed_at = EXCLUDED.failed_at
+            """,
+            s=service, e=event_id, err=error,
+        )
+
+    def requeue_dead(self, service, event_ids=None):
+        only = "AND event_id = ANY(:ids)" if event_ids is not None else ""
+        return int(self._exec(
+            f"""
+            WITH r AS (
+                DELETE FROM webhook_dead_letters WHERE service = :s {only} RETURNING event_id
+            )
+            UPDATE webhook_inbox i
+               SET status = 'pending', attempts = 0, last_error = NULL, processed_at = NULL,
+                   next_attempt_at = clock_timestamp()
+              FROM r
+             WHERE i.service = :s AND i.event_id = r.event_id
+            """,
+            s=service, ids=list(event_ids or []),
+        ) or 0)
+
+    def get(self, service, event_id):
+        rows = self._exec(
+            "SELECT event_id, event, status, attempts, last_error FROM webhook_inbox WHERE service = :s AND event_id = :e",
+            s=service, e=event_id,
+        )
+        return InboxRecord(*rows[0]) if rows else None
+
+    def dead_letters(self, service, limit=100):
+        rows = self._exec(
+            """
+            SELECT event_id, event, 'dead', attempts, last_error FROM webhook_dead_letters
+             WHERE service = :s ORDER BY failed_at DESC LIMIT :n
+            """,
+            s=service, n=int(limit),
+        )
+        return [InboxRecord(*r) for r in rows]
+
+    def gc(self, older_than_secs, limit=10_000):
+        return int(self._exec(
+            """
+            DELETE FROM webhook_inbox WHERE (service, event_id) IN (
+                SELECT service, event_id FROM webhook_inbox
+                 WHERE status = 'done' AND processed_at <= clock_timestamp() - make_interval(secs => :age)
+                 LIMIT :n
+            )
+            """,
+            age=float(older_than_secs), n=int(limit),
+        ) or 0)
+
+
+def webhook_inbox_store_from_env(engine=None) -> InboxStore:
+    """``WEBHOOK_INBOX_BACKEND`` = db|memory (default: db with an engine, else memory)."""
+    backend = (os.getenv("WEBHOOK_INBOX_BACKEND", "") or "").lower() or ("db" if engine is not None else "memory")
+    if backend == "db" and engine is not None:
+        return SqlInboxStore(engine)
+    return MemoryInboxStore()
+
+
+# --- receiver ---------------------------------------------------------------------
+
+
+_stats: Dict[str, Counter] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(service: str, what: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats.setdefault(service, Counter())[what] += n
+
+
+def webhook_inbox_stats() -> Dict[str, Dict[str, int]]:
+    """Per service: received, duplicate, rejected_<reason>, handled, ignored, retried, dead, errors, gc_deleted."""
+    with _stats_lock:
+        return {s: dict(c) for s, c in _stats.items()}
+
+
+class WebhookInbox:
+    """Verify, record and dispatch one service's inbound webhooks (see the module docstring)."""
+
+    def __init__(
+        self,
+        service: str,
+        store: InboxStore,
+        secrets: Secrets,
+        *,
+        tolerance_secs: float = 300,
+        max_attempts: int = 8,
+        retry_base_secs: float = 5,
+        retry_max_secs: float = 900,
+        lease_secs: float = 60,
+    ):
+        self.service = service
+        self.store = store
+        self._secrets = secrets
+        self.tolerance_secs = tolerance_secs
+        self.max_attempts = max_attempts
+        self.retry_base_secs = retry_base_secs
+        self.retry_max_secs = retry_max_secs
+        self.lease_secs = lease_secs
+        self.handlers: Dict[str, Handler] = {}
+
+    def on(self, *events: str) -> Callable[[Handler], Handler]:
+        def register(fn: Handler) -> Handler:
+            for e in events:
+                self.handlers[e] = fn
+            return fn
+
+        return register
+
+    def secrets(self) -> List[str]:
+        s = self._secrets() if callable(self._secrets) else self._secrets
+        return parse_secrets(s) if isinstance(s, str) else [x for x in s if x]
+
+    def receive(self, body: bytes, headers: Mapping[str, str], now: Optional[float] = None) -> Receipt:
+        """Verify and record a delivery (``headers`` keys lower-case); raises ``WebhookVerificationError``."""
+        ts, event = headers.get("x-webhook-ts"), headers.get("x-webhook-event")
+        try:
+            verify_webhook(body, ts, event, headers.get("x-webhook-sign"), self.secrets(), self.tolerance_secs, now)
+            payload = json.loads(body)
+            if not isinstance(payload, dict):
+                raise ValueError("payload is not an object")
+        except WebhookVerificationError as e:
+            _count(self.service, f"rejected_{e.reason}")
+            raise
+        except ValueError:
+            _count(self.service, "rejected_bad_body")
+            raise WebhookVerificationError("bad_body")
+        event_id = event_id_for(headers, ts, event, body, payload)
+        fresh = self.store.add(self.service, event_id, event, body.decode("utf-8"))
+        _count(self.service, "received" if fresh else "duplicate")
+        return Receipt(event_id, duplicate=not fresh)
+
+    async def receive_request(self, request, background=None) -> Dict[str, Any]:
+        """FastAPI glue: 403 on a bad signature or stale timestamp, 400 on a non-JSON body, else ack and dispatch."""
+        from fastapi import HTTPException  # type: ignore
+
+        body = await request.body()
+        try:
+            receipt = self.receive(body, {k.lower(): v for k, v in request.headers.items()})
+        except WebhookVerificationError as e:
+            if e.reason == "bad_body":
+                raise HTTPException(status_code=400, detail="Invalid payload")
+            raise HTTPException(status_code=403, detail="Invalid signature" if e.reason != "stale" else "Stale webhook")
+        if not receipt.duplicate:
+            if background is not None:
+                background.add_task(self.dispatch, receipt.event_id)
+            else:
+                self.dispatch(receipt.event_id)
+        return {"detail": "ok", "event_id": receipt.event_id, "duplicate": receipt.duplicate}
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.retry_max_secs, self.retry_base_secs * (2 ** max(0, attempts - 1)))
+
+    def _run(self, ev: InboundEvent) -> str:
+        handler = self.handlers.get(ev.event)
+        if handler is None:
+            self.store.done(self.service, ev.event_id)
+            _count(self.service, "ignored")
+            return "ignored"
+        try:
+            handler(ev)
+        except Exception as e:
+            err = f"{type(e).__name__}: {e}"[:1000]
+            if ev.attempts >= self.max_attempts:
+                log.error("webhook %s/%s dead after %d attempts: %s", self.service, ev.event_id, ev.attempts, err)
+                self.store.dead(self.service, ev.event_id, err)
+                _count(self.service, "dead")
+                return "dead"
+            log.warning("webhook %s/%s attempt %d failed: %s", self.service, ev.event_id, ev.attempts, err)
+            self.store.retry(self.service, ev.event_id, self.backoff(ev.attempts), err)
+            _count(self.service, "retried")
+            return "retried"
+        self.store.done(self.service, ev.event_id)
+        _count(self.service, "handled")
+        return "handled"
+
+    def dispatch(self, event_id: str) -> Optional[str]:
+        """Run one recorded event now if it is due and unclaimed; returns the outcome (None if not claimed)."""
+        try:
+            claimed = self.store.claim(self.service, 1, self.lease_secs, event_id=event_id)
+        except Exception:
+            # The retry job picks it up; the sender already has its 200
+            log.warning("webhook %s/%s: dispatch failed", self.service, event_id, exc_info=True)
+            _count(self.service, "errors")
+            return None
+        return self._run(claimed[0]) if claimed else None
+
+    def process_due(self, limit: int = 100) -> Dict[str, int]:
+        """Run due and lease-expired events (the retry job); returns outcome counts."""
+        out: Counter = Counter()
+        for ev in self.store.claim(self.service, limit, self.lease_secs):
+            out[self._run(ev)] += 1
+        return dict(out)
+
+    def requeue_dead(self, event_ids: Optional[Sequence[str]] = None) -> int:
+        return self.store.requeue_dead(self.service, event_ids)
+
+    def gc(self, older_than_secs: float = 7 * 86400, limit: int = 10_000) -> int:
+        # Ids must outlive the replay window or a replayed delivery would be accepted again
+        n = self.store.gc(max(older_than_secs, 2 * self.tolerance_secs), limit)
+        if n:
+            _count(self.service, "gc_deleted", n)
+        return n
+
+
+def register_prometheus_collector(registry=None) -> bool:
+    """Expose ``webhook_inbox_events_total{service,outcome}``."""
+    try:
+        from prometheus_client import REGISTRY  # type: ignore
+        from prometheus_client.core import CounterMetricFamily  # type: ignore
+    except Exception:
+        return False
+
+    class _InboxCollector:
+        def collect(self):
+            m = CounterMetricFamily("webhook_inbox_events", "Inbound webhook events by outcome", labels=["service", "outcome"])
+            for service, counts in webhook_inbox_stats().items():
+                for outcome, n in counts.items():
+                    m.add_metric([service, outcome], float(n))
+            return [m]
+
+    try:
+        (registry or REGISTRY).register(_InboxCollector())
+    except ValueError:
+        return True
+    except Exception:
+        return False
+    return True
+
+
+__all__ = [
+    "DEAD",
+    "DONE",
+    "InboundEvent",
+    "InboxRecord",
+    "InboxStore",
+    "MemoryInboxStore",
+    "PENDING",
+    "PROCESSING",
+    "Receipt",
+    "SqlInboxStore",
+    "WebhookInbox",
+    "WebhookVerificationError",
+    "event_id_for",
+    "parse_secrets",
+    "register_prometheus_collector",
+    "sign_webhook",
+    "verify_webhook",
+    "webhook_inbox_stats",
+    "webhook_inbox_store_from_env",
+]